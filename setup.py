@@ -29,4 +29,5 @@ setup(
         "interactive": ["nbstripout", "matplotlib", "jupyter"]
     },
     packages=["PETITE"],
+    package_data={"PETITE": ["lumi_integral_data.npy"]},
 )
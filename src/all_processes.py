@@ -1,5 +1,4 @@
 import numpy as np
-import vegas as vg
 import functools
 import random as rnd
 try:
@@ -541,6 +540,206 @@ def sigma_bhabha(event_info):
 
     return PF*(T1+T2)*np.heaviside(Ee-threshold, 1)
 
+#---------------------------------------------------------------------------
+#Vectorized Differential Cross Sections (used as VEGAS batch integrands)
+#Each takes an (N, n_dim) array of integration variables and returns an (N,) array,
+#matching the corresponding point-by-point function above
+#---------------------------------------------------------------------------
+
+def dsigma_brem_dimensionless_batch(event_info, phase_space_par_list):
+    """Array version of dsigma_brem_dimensionless"""
+    ep=event_info['E_inc']
+    Egamma_min = event_info['Eg_min']
+
+    x1, x2, x3, x4 = np.transpose(np.reshape(phase_space_par_list, (-1, 4)))
+    w, d, dp, ph = Egamma_min + x1*(ep - m_electron - Egamma_min), ep/(2*m_electron)*(x2+x3), ep/(2*m_electron)*(x2-x3), (x4-1/2)*2*np.pi
+
+    epp = ep - w
+    physical = (Egamma_min < w) & (w < ep - m_electron) & (m_electron < epp) & (epp < ep) & (d > 0.) & (dp > 0.)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        qsq = m_electron**2*((d**2 + dp**2 - 2*d*dp*np.cos(ph)) + m_electron**2*((1 + d**2)/(2*ep) - (1 + dp**2)/(2*epp))**2)
+        PF = 8.0/np.pi*alpha_em*(alpha_em/m_electron)**2*(epp*m_electron**4)/(w*ep*qsq**2)*d*dp
+        jacobian_factor = np.pi*ep**2*(ep - m_electron - Egamma_min)/m_electron**2
+        FF = g2_elastic(event_info, qsq)
+        T1 = d**2/(1 + d**2)**2
+        T2 = dp**2/(1 + dp**2)**2
+        T3 = w**2/(2*ep*epp)*(d**2 + dp**2)/((1 + d**2)*(1 + dp**2))
+        T4 = -(epp/ep + ep/epp)*(d*dp*np.cos(ph))/((1 + d**2)*(1 + dp**2))
+        dSig0 = PF*(T1+T2+T3+T4)*jacobian_factor*FF
+    return np.where(physical, dSig0, 0.0)
+
+def dsig_etl_helper_batch(params, v):
+    """Array version of dsig_etl_helper: exact tree-level dark photon bremsstrahlung
+    (see dsig_dx_dcostheta_dark_brem_exact_tree_level) evaluated on an (N,3) array of points
+    """
+    me = m_electron
+    mV = params['mV']
+    Ebeam = params['E_inc']
+    MTarget = params['mT']
+
+    x0, x1, x2 = np.transpose(np.reshape(v, (-1, 3)))
+    if ('Method' in params.keys()) == False:
+        params['Method'] = 'Log'
+    if params['Method'] == 'Log':
+        x, l1mct, lttilde = x0, x1, x2
+        one_minus_costheta = 10**l1mct
+        costheta = 1.0 - one_minus_costheta
+        ttilde = 10**lttilde
+        Jacobian = one_minus_costheta*ttilde*np.log(10.0)**2
+    elif params['Method'] == 'Standard':
+        x, costheta, ttilde = x0, x1, x2
+        Jacobian = 1.0
+
+    # points outside the kinematic boundaries are set to zero at the end; the conditions are written
+    # as in the point-by-point version, so that nan values propagate in the same way
+    with np.errstate(divide='ignore', invalid='ignore'):
+        k = np.sqrt((x * Ebeam)**2 - mV**2)
+        p = np.sqrt(Ebeam**2 - me**2)
+        V = np.sqrt(p**2 + k**2 - 2*p*k*costheta)
+
+        utilde = -2 * (x*Ebeam**2 - k*p*costheta) + mV**2
+
+        discr = utilde**2 + 4*MTarget*utilde*((1-x)*Ebeam + MTarget) + 4*MTarget**2 * V**2
+
+        Qplus = V * (utilde + 2*MTarget*((1-x)*Ebeam + MTarget)) + ((1-x)*Ebeam + MTarget) * np.sqrt(discr)
+        Qplus = Qplus/(2*((1-x)*Ebeam + MTarget)**2-2*V**2)
+
+        Qminus = V * (utilde + 2*MTarget*((1-x)*Ebeam + MTarget)) - ((1-x)*Ebeam + MTarget) * np.sqrt(discr)
+        Qminus = Qminus/(2*((1-x)*Ebeam + MTarget)**2-2*V**2)
+
+        Qplus = np.fabs(Qplus)
+        Qminus = np.fabs(Qminus)
+
+        tplus = 2*MTarget*(np.sqrt(MTarget**2 + Qplus**2) - MTarget)
+        tminus = 2*MTarget*(np.sqrt(MTarget**2 + Qminus**2) - MTarget)
+
+        tconv = (2*MTarget*(MTarget + Ebeam)*np.sqrt(Ebeam**2 + m_electron**2)/(MTarget*(MTarget+2*Ebeam) + m_electron**2))**2
+        t = ttilde*tconv
+
+        q0 = -t/(2*MTarget)
+        q = np.sqrt(t**2/(4*MTarget**2)+t)
+        costhetaq = -(V**2 + q**2 + me**2 -(Ebeam + q0 -x*Ebeam)**2)/(2*V*q)
+
+        mVsq2mesq = (mV**2 + 2*me**2)
+        Am2 = -8 * MTarget * (4*Ebeam**2 * MTarget - t*(2*Ebeam + MTarget)) * mVsq2mesq
+        A1 = 8*MTarget**2/utilde
+        Am1 = (8/utilde) * (MTarget**2 * (2*t*utilde + utilde**2 + 4*Ebeam**2 * (2*(x-1)*mVsq2mesq - t*((x-2)*x+2)) + 2*t*(-mV**2 + 2*me**2 + t)) - 2*Ebeam*MTarget*t*((1-x)*utilde + (x-2)*(mVsq2mesq + t)) + t**2*(utilde-mV**2))
+        A0 = (8/utilde**2) * (MTarget**2 * (2*t*utilde + (t-4*Ebeam**2*(x-1)**2)*mVsq2mesq) + 2*Ebeam*MTarget*t*(utilde - (x-1)*mVsq2mesq))
+        Y = -t + 2*q0*Ebeam - 2*q*p*(p - k*costheta)*costhetaq/V
+        W= Y**2 - 4*q**2 * p**2 * k**2 * (1 - costheta**2)*(1 - costhetaq**2)/V**2
+
+        phi_integral = (A0 + Y*A1 + Am1/np.sqrt(W) + Y * Am2/W**1.5)/(8*MTarget**2)
+
+        formfactor_separate_over_tsquared = Gelastic_inelastic_over_tsquared(params, t)
+
+        ans = formfactor_separate_over_tsquared*np.power(alpha_em, 3) * k * Ebeam * phi_integral/(p*np.sqrt(k**2 + p**2 - 2*p*k*costheta))
+
+    physical = ~(x*Ebeam < mV) & ~(discr < 0) & ~(tplus < tminus) & ~((t > tplus) | (t < tminus)) & ~(np.fabs(costhetaq) > 1.) & ~(W < 0)
+    return np.where(physical, ans*tconv*Jacobian, 0.0)
+
+def dsigma_radiative_return_du_batch(event_info, phase_space_par_list):
+    """Array version of dsigma_radiative_return_du"""
+    mV = event_info['mV']
+    Ee = event_info['E_inc']
+
+    u = np.reshape(phase_space_par_list, -1)
+    s = 2.0*m_electron*(Ee+m_electron)
+    if s < mV**2:
+        return np.zeros(len(u))
+    betaf = np.sqrt( 1. - 4.*(m_electron**2) / (mV**2) )
+    prefac = (4.*np.pi**2)*alpha_em*betaf*(3./2. - betaf**2 / 2.)/s
+    return 2.*prefac*transformed_lepton_luminosity_integrand(s, mV**2/s, u)
+
+def dsigma_annihilation_dCT_batch(event_info, phase_space_par_list):
+    """Array version of dsigma_annihilation_dCT"""
+    Ee=event_info['E_inc']
+    mV = event_info.get('mV', 0.0)
+    EgMin = event_info.get('Eg_min', 0.0)
+    s = 2.0*m_electron*(Ee+m_electron)
+
+    ct = np.reshape(phase_space_par_list, -1)
+    if s < mV**2:
+        return np.zeros(len(ct))
+    ctMax = np.sqrt((Ee+m_electron)/(Ee-m_electron))*(2*m_electron*(Ee-2*EgMin+m_electron)-mV**2)/(2*m_electron*(Ee+m_electron)-mV**2)
+    b = np.sqrt(1.0 - 4.0*m_electron**2/s)
+    dSigs = 4.0*np.pi*alpha_em**2/(s*(1 - b**2*ct**2))*((s-mV**2)/(2*s)*(1+ct**2) + 2.0*mV**2/(s-mV**2))
+    return np.where(ct > ctMax, 0.0, dSigs)
+
+def dsigma_pairprod_dimensionless_batch(event_info, phase_space_par_list):
+    """Array version of dsigma_pairprod_dimensionless"""
+    w=event_info['E_inc']
+
+    x1, x2, x3, x4 = np.transpose(np.reshape(phase_space_par_list, (-1, 4)))
+    epp, dp, dm, ph = m_electron + x1*(w-2*m_electron), w/(2*m_electron)*(x2+x3), w/(2*m_electron)*(x2-x3), x4*2*np.pi
+
+    epm = w - epp
+    physical = (m_electron < epm) & (epm < w) & (m_electron < epp) & (epp < w) & (dm > 0.) & (dp > 0.)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        qsq_over_m_electron_sq = (dp**2 + dm**2 + 2.0*dp*dm*np.cos(ph)) + m_electron**2*((1.0 + dp**2)/(2.0*epp) + (1.0+dm**2)/(2.0*epm))**2
+        PF = 8.0/np.pi*alpha_em*(alpha_em/m_electron)**2*epp*epm/(w**3*qsq_over_m_electron_sq**2)*dp*dm
+        jacobian_factor = np.pi*w**2*(w-2*m_electron)/m_electron**2
+        FF = g2_elastic(event_info, m_electron**2*qsq_over_m_electron_sq)
+
+        T1 = -1.0*dp**2/(1.0 + dp**2)**2
+        T2 = -1.0*dm**2/(1.0 + dm**2)**2
+        T3 = w**2/(2.0*epp*epm)*(dp**2 + dm**2)/((1.0 + dp**2)*(1.0 + dm**2))
+        T4 = (epp/epm + epm/epp)*(dp*dm*np.cos(ph))/((1.0 + dp**2)*(1.0+dm**2))
+
+        dSig0 = PF*(T1+T2+T3+T4)*jacobian_factor*FF
+    return np.where(physical, dSig0, 0.0)
+
+def dsigma_compton_dCT_batch(event_info, phase_space_par_list):
+    """Array version of dsigma_compton_dCT"""
+    Eg=event_info['E_inc']
+    mV = event_info.get('mV', 0.0)
+
+    ct = np.reshape(phase_space_par_list, -1)
+    s = m_electron**2 + 2*Eg*m_electron
+    if s < (m_electron + mV)**2:
+        return np.zeros(len(ct))
+
+    sqrt_lambda = np.sqrt(m_electron**4 + (mV**2 - s)**2 - 2*m_electron**2*(mV**2 + s))
+    jacobian = (s-m_electron**2)/(2*s)*np.sqrt((s-mV**2)**2 -2*m_electron**2*(s+mV**2) + m_electron**4)
+
+    t = -1/2*(m_electron**4 + s*(-mV**2 + s + ct*sqrt_lambda) - m_electron**2*(mV**2 + 2*s + ct*sqrt_lambda))/s
+    PF = 2.0*np.pi*alpha_em**2/(s-m_electron**2)**2
+
+    if mV == 0.:
+        T1 = (6.0*m_electron**2*s + 3.0*m_electron**4 - s**2)/((m_electron**2-s)*(-m_electron**2+s+t))
+        T2 = 4*m_electron**4/(s+t-m_electron**2)**2
+        T3 = (t*(s-m_electron**2) + (s+m_electron**2)**2)/(s-m_electron**2)**2
+    else:
+        T1 = (2.0*m_electron**2*(mV**2-3*s)-3*m_electron**4-2*mV**2*s+2*mV**4+s**2)/((m_electron**2-s)*(m_electron**2+mV**2-s-t))
+        T2 = (2*m_electron**2*(2*m_electron**2+mV**2))/(m_electron**2+mV**2-s-t)**2
+        T3 = ((m_electron**2+s)*(m_electron**2+mV**2+s)+t*(s-m_electron**2))/(m_electron**2-s)**2
+
+    return PF*jacobian*(T1+T2+T3)
+
+def dsigma_moller_dCT_batch(event_info, phase_space_par_list):
+    """Array version of dsigma_moller_dCT"""
+    Ee = event_info['E_inc']
+    DE = event_info.get('Ee_min', 0.010)
+    delta_ct_limit = 2.0*DE/(Ee - m_electron)
+
+    ct = np.reshape(phase_space_par_list, -1)
+    s = m_electron**2 + 2*Ee*m_electron
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dSigs = 16*np.pi**2*alpha_em**2*(s**2*(3+ct**2)**2 - 8*m_electron**2*s*(7+ct**4)+16*m_electron**4*(6-3*ct**2+ct**4))/(8*np.pi*s*(s-4*m_electron**2)**2*(1-ct)**2*(1+ct)**2)
+    return np.where((ct < -1 + delta_ct_limit) | (ct > 1.0 - delta_ct_limit), 0.0, dSigs)
+
+def dsigma_bhabha_dCT_batch(event_info, phase_space_par_list):
+    """Array version of dsigma_bhabha_dCT"""
+    Ee = event_info['E_inc']
+    DE = event_info.get('Ee_min', 0.010)
+    delta_ct_limit = 2.0*DE/(Ee - m_electron)
+
+    ct = np.reshape(phase_space_par_list, -1)
+    s = m_electron**2 + 2*Ee*m_electron
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dSigs = (alpha_em**2*np.pi*(256*(-1 + ct)**2*ct**2*m_electron**8 - 128*(-1 + ct)*(1 + ct*(1 + ct)*(-3 + 2*ct))*m_electron**6*s + 16*(7 + ct*(2 + ct*(-5 + 6*(-1 + ct)*ct)))\
+                    *m_electron**4*s**2 - 8*(7 + ct*(-3 + ct*(3 + ct*(-1 + 2*ct))))*m_electron**2*s**3 + (3 + ct**2)**2*s**4))/(2*(-1 + ct)**2*s**3*(-4*m_electron**2 + s)**2)
+    return np.where((ct < -1 + delta_ct_limit) | (ct > 1.0 - delta_ct_limit), 0.0, dSigs)
+
 #Function for drawing unweighted events from a weighted distribution
 def get_points(distribution, npts):
     """If weights are too cumbersome, this function returns a properly-weighted sample from Dist"""
@@ -569,6 +768,17 @@ diff_xsection_options={"PairProd" : dsigma_pairprod_dimensionless,
                        "DarkComp" : dsigma_compton_dCT,
                        "DarkBrem" :  dsig_etl_helper}
 
+# Vectorized versions of diff_xsection_options, used as VEGAS batch integrands
+diff_xsection_batch_options={"PairProd" : dsigma_pairprod_dimensionless_batch,
+                             "Comp"     : dsigma_compton_dCT_batch,
+                             "Moller"   : dsigma_moller_dCT_batch,
+                             "Bhabha"   : dsigma_bhabha_dCT_batch,
+                             "Brem"     : dsigma_brem_dimensionless_batch,
+                             "Ann"      : dsigma_annihilation_dCT_batch,
+                             "DarkAnn"  : dsigma_radiative_return_du_batch,
+                             "DarkComp" : dsigma_compton_dCT_batch,
+                             "DarkBrem" : dsig_etl_helper_batch}
+
 vegas_integrator_options = {"PairProd":{"nitn":10, "nstrat":[60, 50, 40, 50]},
                             "Brem":{"nitn":10, "nstrat":[60, 50, 50, 50]},
                             "DarkBrem":{"nitn":20, "nstrat":[100, 100, 40]},
@@ -579,6 +789,11 @@ vegas_integrator_options = {"PairProd":{"nitn":10, "nstrat":[60, 50, 40, 50]},
                             "DarkAnn":{"nitn":10, "neval":10000},
                             "DarkComp":{"nitn":20, "nstrat":[1000]}}
       
+# Adaptation used when an integrator is warm-started from the map of a neighbouring energy (see vegas_integration):
+# rounds of nitn iterations are run until two consecutive rounds give integrals that agree within rtol and
+# the relative uncertainty of a round no longer improves by more than sdev_rtol, for at most max_rounds rounds
+vegas_warm_start_options = {"nitn":3, "max_rounds":6, "rtol":0.02, "sdev_rtol":0.1}
+
 four_dim = {"PairProd", "Brem"}
 three_dim = {"DarkBrem"}
 one_dim = {"Comp", "Ann","Moller","Bhabha", "DarkAnn", "DarkComp"}
@@ -640,7 +855,48 @@ def integration_range(event_info, process):
     else:
         raise Exception("Your process is not in the list")
 
-def vegas_integration(event_info, process, verbose=False, mode='XSec'):
+def rescaled_adaptive_map(adaptive_map, igrange):
+    """Maps the grid of a trained VEGAS AdaptiveMap linearly onto a new integration range,
+    so that it can be used as the starting point for training at a neighbouring energy
+    Args:
+        adaptive_map: trained vegas.AdaptiveMap
+        igrange: list of integration ranges for each dimension (as from integration_range)
+    Returns:
+        vegas.AdaptiveMap covering igrange
+    """
+    import vegas as vg
+    grid = []
+    for dim, (x_min, x_max) in enumerate(igrange):
+        old_grid = np.array(adaptive_map.grid[dim, :adaptive_map.ninc[dim] + 1])
+        if old_grid[-1] > old_grid[0]:
+            grid.append(x_min + (old_grid - old_grid[0])*(x_max - x_min)/(old_grid[-1] - old_grid[0]))
+        else:
+            grid.append(np.linspace(x_min, x_max, len(old_grid)))
+    return vg.AdaptiveMap(grid)
+
+def warm_start_adaptation(integrand, func, process, verbose=False):
+    """Adapts a warm-started VEGAS integrator in short rounds until the integral estimates of
+    two consecutive rounds agree (see vegas_warm_start_options)
+    Returns:
+        result of the last round
+    """
+    options = dict(vegas_integrator_options[process], nitn=vegas_warm_start_options["nitn"])
+    previous = integrand(func, **options)
+    for n_round in range(1, vegas_warm_start_options["max_rounds"]):
+        result = integrand(func, **options)
+        integral_converged = np.abs(result.mean - previous.mean) <= vegas_warm_start_options["rtol"]*np.abs(result.mean)
+        # the relative uncertainty of a round measures the quality of the map, it stops improving once the map has adapted
+        map_converged = result.sdev*np.abs(previous.mean) >= (1. - vegas_warm_start_options["sdev_rtol"])*previous.sdev*np.abs(result.mean)
+        if integral_converged and map_converged:
+            if verbose:
+                print("Warm-started adaptation converged after", n_round + 1, "rounds")
+            return result
+        previous = result
+    if verbose:
+        print("Warm-started adaptation not converged after", vegas_warm_start_options["max_rounds"], "rounds")
+    return result
+
+def vegas_integration(event_info, process, verbose=False, mode='XSec', adaptive_map=None, batch=True):
     """Function for Integration of Various SM/BSM Differential
        Cross Sections.
 
@@ -671,6 +927,13 @@ def vegas_integration(event_info, process, verbose=False, mode='XSec'):
              -- 'Pickle': return VEGAS integrator object
              -- 'Sample': return VEGAS sample (including weights)
              -- 'UnweightedSample' return unweighted sample of events
+            adaptive_map: trained VEGAS map of the same process at a neighbouring energy (e.g. the previous
+             point of an energy grid). If given, the integrator is started from this map (rescaled to the
+             integration range) and only a short adaptation with a convergence check is run instead of the
+             full burn-in (see vegas_warm_start_options)
+            batch: if True (default), VEGAS evaluates the vectorized cross section (diff_xsection_batch_options)
+             on whole batches of points; if False, the point-by-point version (diff_xsection_options) is used,
+             e.g. to cross-check the two
     """
     if process in diff_xsection_options:
         if ('mV' in event_info.keys()) == False:
@@ -683,14 +946,25 @@ def vegas_integration(event_info, process, verbose=False, mode='XSec'):
         diff_xsec_func = diff_xsection_options[process] 
     else:
         raise Exception("You process is not in the list")
-    integrand = vg.Integrator(igrange)
+    import vegas as vg
+    if batch:
+        vegas_func = vg.batchintegrand(functools.partial(diff_xsection_batch_options[process], event_info))
+    else:
+        vegas_func = functools.partial(diff_xsec_func, event_info)
+    if adaptive_map is None:
+        integrand = vg.Integrator(igrange)
+    else:
+        integrand = vg.Integrator(rescaled_adaptive_map(adaptive_map, igrange))
     if mode == 'Pickle' or mode == 'XSec':
         if verbose:
             print("Integrator set up", process, event_info)
-        integrand(functools.partial(diff_xsec_func, event_info), **vegas_integrator_options[process])
-        if verbose:
-            print("Burn-in complete", event_info)
-        result = integrand(functools.partial(diff_xsec_func, event_info), **vegas_integrator_options[process])
+        if adaptive_map is None:
+            integrand(vegas_func, **vegas_integrator_options[process])
+            if verbose:
+                print("Burn-in complete", event_info)
+            result = integrand(vegas_func, **vegas_integrator_options[process])
+        else:
+            result = warm_start_adaptation(integrand, vegas_func, process, verbose=verbose)
         if verbose:
             print("Fully Integrated", event_info, result.mean)
         if mode == 'Pickle':
@@ -698,12 +972,15 @@ def vegas_integration(event_info, process, verbose=False, mode='XSec'):
         else:
             return result.mean
     elif mode == 'Sample' or mode == 'UnweightedSample':
-        integrand(functools.partial(diff_xsec_func, event_info), **vegas_integrator_options[process])
-        result = integrand(functools.partial(diff_xsec_func, event_info), **vegas_integrator_options[process])
+        if adaptive_map is None:
+            integrand(vegas_func, **vegas_integrator_options[process])
+            result = integrand(vegas_func, **vegas_integrator_options[process])
+        else:
+            result = warm_start_adaptation(integrand, vegas_func, process)
 
         integral, pts = 0.0, []
         for x, wgt in integrand.random_batch():
-            integral += wgt.dot(diff_xsec_func(event_info, x))
+            integral += wgt.dot(diff_xsection_batch_options[process](event_info, x))
         if verbose:
             print(integral)
         NSamp = 1
@@ -1,33 +1,33 @@
 import numpy as np
 import pickle 
 import os
-
-from scipy.interpolate import interp1d
-from scipy.integrate import quad
+import tempfile
 
 from .moliere import get_scattered_momentum_fast, get_scattered_momentum_Bethe
-from .particle import Particle, meson_twobody_branchingratios
+from .particle import Particle, meson_twobody_branchingratios, mass_dict, energy_loss_fourvector, rotation_matrix, two_body_decay_batch
+from .particle_table import ParticleTable, generation_process_codes
 from .kinematics import e_to_eV_fourvecs, compton_fourvecs, radiative_return_fourvecs
+from .kinematics import e_to_eV_fourvecs_batch, compton_fourvecs_batch, radiative_return_fourvecs_batch
 from .shower import Shower
 from .all_processes import *
-from copy import deepcopy
 
-class interpolate1d(interp1d):
-    """Extend scipy interp1d to interpolate/extrapolate per axis in log space"""
+class interpolate1d:
+    """Wrap scipy interp1d to interpolate/extrapolate per axis in log space"""
     
     def __init__(self, x, y, *args, xspace='linear', yspace='linear', **kwargs):
+        from scipy.interpolate import interp1d
         self.xspace = xspace
         self.yspace = yspace
         if self.xspace == 'log': x = np.log10(x + 1e-20)
         if self.yspace == 'log': y = np.log10(y + 1e-20)
-        super().__init__(x, y, *args, **kwargs)
+        self._interp1d = interp1d(x, y, *args, **kwargs)
         
     def __call__(self, x, *args, **kwargs):
         if self.xspace == 'log': x = np.log10(x)
         if self.yspace == 'log':
-            return 10**super().__call__(x, *args, **kwargs)
+            return 10**self._interp1d(x, *args, **kwargs)
         else:
-            return super().__call__(x, *args, **kwargs)
+            return self._interp1d(x, *args, **kwargs)
         
 import sys
 from numpy.random import random as draw_U
@@ -44,10 +44,142 @@ dark_process_codes = ["DarkBrem", "DarkAnn", "DarkComp", "TwoBody_BSMDecay"]
 dark_kinematic_function = {"DarkBrem" : e_to_eV_fourvecs,
                            "DarkAnn"      : radiative_return_fourvecs,
                            "DarkComp"     : compton_fourvecs}
+#array versions, which only need the incoming energies rather than Particle objects
+dark_kinematic_function_batch = {"DarkBrem" : e_to_eV_fourvecs_batch,
+                                 "DarkAnn"      : radiative_return_fourvecs_batch,
+                                 "DarkComp"     : compton_fourvecs_batch}
+
+def dark_vector_cos_theta(process, energies, sampled_events, mV):
+    """Cosine of the angle between the dark vector and the incoming particle, in the frame where the
+    target electron/nucleus is at rest, for an (N,d) array of dark samples (see dark_kinematic_function_batch)
+    """
+    energies = np.asarray(energies, dtype=float)*np.ones(len(sampled_events))
+    if process == "DarkBrem":
+        return 1.0 - 10**sampled_events[:,1]
+    elif process == "DarkComp":
+        # CM-frame vector opposite to the electron at cos(theta) = ct, boosted along z as in compton_fourvecs_batch
+        ct = sampled_events[:,0]
+        s = m_electron**2 + 2*energies*m_electron
+        EV = (s + mV**2 - m_electron**2)/(2*np.sqrt(s))
+        pF = np.sqrt(EV**2 - mV**2)
+        g0 = (s + m_electron**2)/(2.0*np.sqrt(s))/m_electron
+        b0 = np.sqrt(g0**2 - 1.0)/g0
+        pz = b0*g0*EV - g0*pF*ct
+        return pz/np.sqrt(pz**2 + pF**2*(1 - ct**2))
+    elif process == "DarkAnn":
+        # collinear radiative return
+        return np.ones(len(sampled_events))
+    raise Exception("Your process is not in the list")
+
 diff_xsection_options={"DarkComp"      : dsigma_compton_dCT,
                         "DarkBrem" : dsig_etl_helper,
                         "DarkAnn"      : dsigma_radiative_return_du }
 
+def dark_table_shard(dict_dir, table_name, mV, target_material):
+    """Path of the file storing table_name ('dark_weights' or 'dark_drate') for one (mV, target_material)"""
+    return os.path.join(dict_dir, table_name, str(float(mV)) + "_" + target_material + ".pkl")
+
+def load_dark_table(dict_dir, table_name, mV, target_material):
+    """Loads the precomputed table_name entry of (mV, target_material) from its shard file. 
+    Single-file tables dict_dir/<table_name>.pkl written by earlier versions are not read: they were 
+    integrated with a less accurate quadrature, so their entries are recomputed instead.
+    Returns:
+        the table entry, or None if it has not been computed
+    """
+    shard_file_name = dark_table_shard(dict_dir, table_name, mV, target_material)
+    if os.path.exists(shard_file_name):
+        with open(shard_file_name, 'rb') as shard_file:
+            return pickle.load(shard_file)
+    return None
+
+def save_dark_table(dict_dir, table_name, mV, target_material, table):
+    """Writes the table_name entry of (mV, target_material) to its shard file. The entry is written to a
+    temporary file in the same directory and renamed into place, so that concurrent jobs never read a 
+    partially written file and jobs computing different (mV, target_material) never overwrite each other.
+    """
+    shard_file_name = dark_table_shard(dict_dir, table_name, mV, target_material)
+    os.makedirs(os.path.dirname(shard_file_name), exist_ok=True)
+    file_descriptor, temporary_file_name = tempfile.mkstemp(dir=os.path.dirname(shard_file_name), suffix='.tmp')
+    #mkstemp creates the file readable by its owner only, give it the permissions of a regularly created file
+    umask = os.umask(0)
+    os.umask(umask)
+    try:
+        with os.fdopen(file_descriptor, 'wb') as temporary_file:
+            pickle.dump(table, temporary_file)
+        os.chmod(temporary_file_name, 0o666 & ~umask)
+        os.replace(temporary_file_name, shard_file_name)
+    except BaseException:
+        os.remove(temporary_file_name)
+        raise
+
+quadrature_order = 8 #Gauss-Legendre points per segment for the dark weight and dRate/dE tables
+
+def segment_quadrature(integrand, lower, upper, breakpoints, order=quadrature_order):
+    """Integrates integrand over the intervals [lower[k], upper[k]] at once with composite fixed-order
+    Gauss-Legendre quadrature, splitting each interval at the breakpoints that lie inside it
+    (e.g. the nodes of the interpolated cross sections, where the integrand has kinks).
+    Args:
+        integrand: vectorized function of a (K, n_points) array of energies, where row k belongs to interval k
+        lower, upper: (K,) arrays of integration limits
+        breakpoints: array of energies, either shared by all intervals or a (K, m) array with m energies per interval
+        order: number of Gauss-Legendre points per segment
+    Returns:
+        (K,) array of integrals
+    """
+    lower, upper = np.asarray(lower, dtype=float)[:,None], np.asarray(upper, dtype=float)[:,None]
+    breakpoints = np.asarray(breakpoints, dtype=float)
+    edges = np.concatenate([lower, np.broadcast_to(breakpoints, (len(lower), breakpoints.shape[-1])), upper], axis=1)
+    edges = np.sort(np.clip(edges, lower, upper), axis=1)
+    #only segments with non-zero width are evaluated
+    segment_lower, segment_upper = edges[:,:-1], edges[:,1:]
+    rows, columns = np.nonzero(segment_upper > segment_lower)
+    half_widths = 0.5*(segment_upper[rows, columns] - segment_lower[rows, columns])
+    midpoints = 0.5*(segment_upper[rows, columns] + segment_lower[rows, columns])
+    nodes, node_weights = np.polynomial.legendre.leggauss(order)
+
+    #integrand rows have a common length: pad each interval with zero-weight copies of its lower limit
+    n_segments = np.bincount(rows, minlength=len(lower))
+    slots = np.arange(len(rows)) - np.concatenate([[0], np.cumsum(n_segments)[:-1]])[rows]
+    energies = np.repeat(lower, max(np.max(n_segments, initial=0), 1)*order, axis=1)
+    weights = np.zeros_like(energies)
+    point_columns = slots[:,None]*order + np.arange(order)
+    energies[rows[:,None], point_columns] = midpoints[:,None] + half_widths[:,None]*nodes
+    weights[rows[:,None], point_columns] = half_widths[:,None]*node_weights
+    integrand_values = integrand(energies)
+    integrand_values[weights == 0.0] = 0.0
+    return np.sum(weights*integrand_values, axis=1)
+
+def drate_arrays(d_rate):
+    """Converts a dRate/dE table {Ei: [[E, rate], ...]} into dense arrays padded with zero rates.
+    Tables that are already in array form are returned unchanged.
+    Returns:
+        {'energies': (K,) sorted energies Ei, 'bin_energies': (K, n_bins), 'rates': (K, n_bins)}
+    """
+    if 'energies' in d_rate:
+        return d_rate
+    energies = np.sort(np.array(list(d_rate.keys()), dtype=float))
+    rows = [np.reshape(np.asarray(d_rate[Ei], dtype=float), (-1, 2)) for Ei in energies]
+    n_bins = max(len(row) for row in rows)
+    bin_energies, rates = np.zeros((len(energies), n_bins)), np.zeros((len(energies), n_bins))
+    for ii, row in enumerate(rows):
+        bin_energies[ii, :len(row)], rates[ii, :len(row)] = row[:,0], row[:,1]
+    return {'energies':energies, 'bin_energies':bin_energies, 'rates':rates}
+
+def drate_sampling_table(d_rate):
+    """Adds the cumulative distribution of interaction energies of each Ei to a dRate/dE table
+    (dict or array form), see drate_arrays. 'total' is the summed rate of each Ei; it is set to zero
+    (no emission) where the rates are not finite, e.g. above the energy range of the SM cross section tables.
+    """
+    table = dict(drate_arrays(d_rate))
+    totals = np.sum(table['rates'], axis=1)
+    totals[~np.all(np.isfinite(table['rates']), axis=1)] = 0.0
+    cdf = np.ones_like(table['rates'])
+    for ii in np.flatnonzero(totals > 0.0):
+        cdf[ii] = np.cumsum(table['rates'][ii]/totals[ii])
+        cdf[ii] /= cdf[ii][-1]
+    table['total'], table['cdf'] = totals, cdf
+    return table
+
 class DarkShower(Shower):
     """ A class to reprocess an existing EM shower to generate dark photons
     """
@@ -56,7 +188,7 @@ class DarkShower(Shower):
                  mode="exact", maxF_fudge_global=1,
                  max_n_integrators=int(1e4), kinetic_mixing=1.0,
                  g_e=None, active_processes=None, fast_MCS_mode=True ,
-                 rescale_MCS=1):
+                 rescale_MCS=1, detector=None):
         super().__init__(dict_dir, target_material, min_energy, target_length)
         """Initializes the dark shower object.
         Args:
@@ -68,6 +200,8 @@ class DarkShower(Shower):
             finishes its propagation through the target
             mV_in_GeV: vector mass in GeV 
             mode: determines whether mV is set to MV_in_GeV or the nearest value for which integrators have been trained
+            detector: optional (distance, radius) in meters of a detector disk centered on the beam axis, 
+            dark vectors are then only sampled in directions that can cross it (see set_detector)
         """
 
         self.active_processes = active_processes
@@ -98,6 +232,39 @@ class DarkShower(Shower):
 
         self._maxF_fudge_global=maxF_fudge_global
         self._max_n_integrators=max_n_integrators
+        self.set_detector(detector)
+
+    def set_detector(self, detector):
+        """Declares a detector disk of (distance, radius) in meters, perpendicular to and centered on 
+        the beam (z) axis as in detector_cut, or None to sample dark vectors in all directions.
+        With a detector, the angle between each dark vector and its parent is restricted to the cone that 
+        can reach the disk and the weight of the dark vector is multiplied by the fraction of the 
+        emission rate inside that cone. The weighted flux through the detector is unchanged, while 
+        dark vectors that would miss it are no longer sampled. Meson decays are not restricted."""
+        self._detector = detector
+
+    def get_detector(self):
+        """Get the detector disk (distance, radius) used to restrict the dark vector directions, None if unrestricted"""
+        return self._detector
+
+    def _detector_cos_theta_min(self, p_emit, r_emit):
+        """Smallest cosine of the angle between a dark vector and its parent direction for which the dark 
+        vector, produced at r_emit, can cross the detector disk. The disk lies within the sphere of radius 
+        `radius' around its center, so the cone around the parent direction opens up to the angle towards 
+        the center plus the angular radius of that sphere.
+        Args:
+            p_emit: (K,4) array of parent four-momenta at the emission
+            r_emit: position of the emission in meters
+        Returns:
+            (K,) array, -1 where all directions are allowed
+        """
+        distance, radius = self._detector
+        to_center = np.array([0.0, 0.0, distance]) - np.asarray(r_emit, dtype=float)
+        center_distance = np.linalg.norm(to_center)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cos_center = np.sum(p_emit[:,1:]*to_center, axis=1)/(np.linalg.norm(p_emit[:,1:], axis=1)*center_distance)
+            theta_max = np.arccos(np.clip(cos_center, -1.0, 1.0)) + np.arcsin(min(radius/center_distance, 1.0))
+        return np.where(theta_max < np.pi, np.cos(theta_max), -1.0)
 
     def set_MCS_rescale_factor(self, rescale_MCS):
         self._MCS_rescale_factor=rescale_MCS
@@ -233,149 +400,201 @@ class DarkShower(Shower):
         dEdxT_GeVpercm = self.get_material_properties()[3]*(0.1)*cmtom #Converting MeV/cm to GeV/m to GeV/cm
         return self._NSigmaDarkBrem(E)/dEdxT_GeVpercm*self._positron_exponential_factor(E, Ei)
 
+    def _quadrature_breakpoints(self, process):
+        """Energies at which the integrands of the dark weight tables have kinks: the nodes of the 
+        dark cross section and of the SM interaction integrals in the exponential factors"""
+        if process == "DarkAnn":
+            dark_energies = np.transpose(self.get_DarkAnnXSec())[0]
+        else:
+            dark_energies = np.transpose(self.get_DarkBremXSec())[0]
+        return np.unique(np.concatenate([dark_energies, self._interaction_integral_Brem.x, self._interaction_integral_Ann.x,
+                                         self._interaction_integral_Bhabha.x, self._interaction_integral_Moller.x]))
+
+    def _integrate_dark_rate(self, integrand, lower, upper, Ei, process, PID):
+        """Integrates integrand(E, Ei[k]) over [lower[k], upper[k]] for all k at once.
+        The exponential factor confines the integrand to a few mean free paths of energy loss below Ei 
+        (a small fraction of [lower, Ei] at high energies), so the ten mean free paths below Ei are 
+        integrated in segments of one mean free path each."""
+        Ei = np.asarray(Ei, dtype=float)
+        dEdxT_GeVperm = self.get_material_properties()[3]*(0.1)
+        energy_loss_mfp = self.get_mfp([PID, Ei])*dEdxT_GeVperm
+        mfp_breakpoints = Ei[:,None] - np.outer(np.nan_to_num(energy_loss_mfp, posinf=0.0), np.arange(1, 11))
+        kinks = self._quadrature_breakpoints(process)
+        breakpoints = np.concatenate([np.broadcast_to(kinks, (len(Ei), len(kinks))), mfp_breakpoints], axis=1)
+        return segment_quadrature(lambda E: integrand(E, Ei[:,None]), lower, upper, breakpoints)
+
     def construct_brem_weight_array(self):
         DBS = self.get_DarkBremXSec()
         initial_energies = np.transpose(DBS)[0]
         minimum_saved_energy = initial_energies[0]
-        brem_elec_weight_array = np.array([quad(self._dark_brem_integrand_elec, minimum_saved_energy, initial_energies[i], args=(initial_energies[i]), full_output=1)[0] for i in range(len(initial_energies))])
-        brem_positron_weight_array = np.array([quad(self._dark_brem_integrand_positron, minimum_saved_energy, initial_energies[i], args=(initial_energies[i]), full_output=1)[0] for i in range(len(initial_energies))])
+        lower = np.full(len(initial_energies), minimum_saved_energy)
+        brem_elec_weight_array = self._integrate_dark_rate(self._dark_brem_integrand_elec, lower, initial_energies, initial_energies, "DarkBrem", 11)
+        brem_positron_weight_array = self._integrate_dark_rate(self._dark_brem_integrand_positron, lower, initial_energies, initial_energies, "DarkBrem", -11)
         return [initial_energies, brem_elec_weight_array, brem_positron_weight_array]
 
     def construct_annihilation_weight_array(self):
         DAnnS = self.get_DarkAnnXSec()
         initial_energies = np.transpose(DAnnS)[0]
         minimum_saved_energy = initial_energies[0]
-        annihilation_weight_array = np.array([quad(self._dark_ann_integrand, minimum_saved_energy, initial_energies[i], args=(initial_energies[i]), full_output=1)[0] for i in range(len(initial_energies))])
+        lower = np.full(len(initial_energies), minimum_saved_energy)
+        annihilation_weight_array = self._integrate_dark_rate(self._dark_ann_integrand, lower, initial_energies, initial_energies, "DarkAnn", -11)
         return [initial_energies, annihilation_weight_array]
 
     def set_weight_arrays(self):
+        from scipy.interpolate import interp1d
         dict_dir = self.get_dark_dict_dir()
-        weights_file_name = dict_dir + "dark_weights.pkl"
-        #check if file named weights_file_name exists
-        files_set = False
-        outer_dict = {}
-        if os.path.exists(weights_file_name):
-            sample_file=open(weights_file_name, 'rb')
-            outer_dict=pickle.load(sample_file)
-            sample_file.close()
-            if self._mV_estimator in outer_dict.keys():
-                if self._target_material in outer_dict[self._mV_estimator].keys():
-                    initial_energies_brem_elec, brem_elec_weight_array = np.transpose(outer_dict[self._mV_estimator][self._target_material]['brem_elec_weights'])
-                    initial_energies_brem_positron, brem_positron_weight_array = np.transpose(outer_dict[self._mV_estimator][self._target_material]['brem_positron_weights'])
-                    initial_energies_annihilation, annihilation_weight_array = np.transpose(outer_dict[self._mV_estimator][self._target_material]['annihilation_weights'])
-                    files_set = True
-        if files_set == False:
+        weights = load_dark_table(dict_dir, "dark_weights", self._mV_estimator, self._target_material)
+        if weights is not None:
+            initial_energies_brem_elec, brem_elec_weight_array = np.transpose(weights['brem_elec_weights'])
+            initial_energies_brem_positron, brem_positron_weight_array = np.transpose(weights['brem_positron_weights'])
+            initial_energies_annihilation, annihilation_weight_array = np.transpose(weights['annihilation_weights'])
+        else:
             print("Weights not previously calculated, calculating now...")
             initial_energies_brem_elec, brem_elec_weight_array, brem_positron_weight_array = self.construct_brem_weight_array()
             initial_energies_brem_positron = initial_energies_brem_elec
             initial_energies_annihilation, annihilation_weight_array = self.construct_annihilation_weight_array()
-            if self._mV_estimator not in outer_dict.keys():
-                outer_dict[self._mV_estimator] = {}
-            outer_dict[self._mV_estimator][self._target_material] = {'brem_elec_weights':np.transpose([initial_energies_brem_elec, brem_elec_weight_array]),
-                                                                     'brem_positron_weights':np.transpose([initial_energies_brem_positron, brem_positron_weight_array]),
-                                                                     'annihilation_weights':np.transpose([initial_energies_annihilation, annihilation_weight_array])}
-            sample_file=open(weights_file_name, 'wb')
-            pickle.dump(outer_dict, sample_file)
-            sample_file.close()
+            save_dark_table(dict_dir, "dark_weights", self._mV_estimator, self._target_material,
+                            {'brem_elec_weights':np.transpose([initial_energies_brem_elec, brem_elec_weight_array]),
+                             'brem_positron_weights':np.transpose([initial_energies_brem_positron, brem_positron_weight_array]),
+                             'annihilation_weights':np.transpose([initial_energies_annihilation, annihilation_weight_array])})
 
         self._brem_elec_numerical_weight = interp1d(initial_energies_brem_elec, brem_elec_weight_array, fill_value=0.0, bounds_error=False)
         self._brem_positron_numerical_weight = interp1d(initial_energies_brem_positron, brem_positron_weight_array, fill_value=0.0, bounds_error=False)
         self._annihilation_numerical_weight = interp1d(initial_energies_annihilation, annihilation_weight_array, fill_value=0.0, bounds_error=False)
     
-    def _d_rate_d_E_elec_brem(self, Ei):
-        dEdxT_GeVperm = self.get_material_properties()[3]*(0.1)
-        mfp_electron_EI = self.get_mfp([11, Ei])
-        energy_loss_ten_mfp = 10*mfp_electron_EI*dEdxT_GeVperm
-        energy_array = np.linspace(np.max([Ei-energy_loss_ten_mfp, self.get_DarkBremXSec()[0][0]]), Ei, 11)
-        energy_center_array = np.array([(energy_array[i] + energy_array[i+1])/2. for i in range(len(energy_array)-1)])
-
-        brem_elec_weights = np.array([quad(self._dark_brem_integrand_elec, energy_array[i], energy_array[i+1], args=(Ei), full_output=1)[0] for i in range(len(energy_array)-1)])
-        return np.transpose([energy_center_array, brem_elec_weights])
-    
-    def _d_rate_d_E_positron_brem(self, Ei):
+    def _d_rate_d_E_brem_batch(self, Ei, PID):
+        """dRate/dE of dark brem for an array of electron (PID=11) or positron (PID=-11) energies Ei, 
+        in 10 bins over the energy lost in ten mean free paths
+        Returns:
+            (K, 10) arrays of bin centers and rates, (K, 11) array of bin edges
+        """
+        Ei = np.asarray(Ei, dtype=float)
         dEdxT_GeVperm = self.get_material_properties()[3]*(0.1)
-        mfp_positron_EI = self.get_mfp([-11, Ei])
-        energy_loss_ten_mfp = 10*mfp_positron_EI*dEdxT_GeVperm
-        energy_array = np.linspace(np.max([Ei-energy_loss_ten_mfp, self.get_DarkBremXSec()[0][0]]), Ei, 11)
-        energy_center_array = np.array([(energy_array[i] + energy_array[i+1])/2. for i in range(len(energy_array)-1)])
-
-        brem_positron_weights = np.array([quad(self._dark_brem_integrand_positron, energy_array[i], energy_array[i+1], args=(Ei), full_output=1)[0] for i in range(len(energy_array)-1)])
-        return np.transpose([energy_center_array, brem_positron_weights])
-
-    def _d_rate_d_E_positron_ann(self, Ei):
-        if Ei < self._resonant_annihilation_energy:
-            return [[[0., 0.]], [0., 1.]]
+        mfp_EI = self.get_mfp([PID, Ei])
+        energy_loss_ten_mfp = 10*mfp_EI*dEdxT_GeVperm
+        energy_array = np.linspace(np.maximum(Ei-energy_loss_ten_mfp, self.get_DarkBremXSec()[0][0]), Ei, 11, axis=-1)
+        energy_center_array = 0.5*(energy_array[:,:-1] + energy_array[:,1:])
+
+        integrand = self._dark_brem_integrand_elec if PID == 11 else self._dark_brem_integrand_positron
+        brem_weights = self._integrate_dark_rate(integrand, energy_array[:,:-1].ravel(), energy_array[:,1:].ravel(), np.repeat(Ei, 10), "DarkBrem", PID)
+        return energy_center_array, np.reshape(brem_weights, (len(Ei), 10)), energy_array
+
+    def _d_rate_d_E_positron_ann_batch(self, Ei):
+        """dRate/dE of dark annihilation for an array of positron energies Ei: a resonant bin 
+        [resonant energy, minimum saved energy] followed by 10 bins over the energy lost in ten mean free paths.
+        Rows with Ei below the resonant energy are zero.
+        Returns:
+            (K, 11) arrays of bin centers and rates, (K, 13) array of bin edges
+        """
+        Ei = np.asarray(Ei, dtype=float)
+        energy_center_array, darkann_weights, energy_array = np.zeros((len(Ei), 11)), np.zeros((len(Ei), 11)), np.zeros((len(Ei), 13))
+        above_resonance = Ei >= self._resonant_annihilation_energy
+        Ei = Ei[above_resonance]
         minimum_saved_energy = self.get_DarkAnnXSec()[0][0]
 
         dEdxT_GeVperm = self.get_material_properties()[3]*(0.1)
         mfp_positron_EI = self.get_mfp([-11, Ei])
         energy_loss_ten_mfp = 10*mfp_positron_EI*dEdxT_GeVperm
-        energy_array = np.linspace(np.max([Ei-energy_loss_ten_mfp, minimum_saved_energy]), Ei, 11)
-        energy_center_array = np.array([(energy_array[i] + energy_array[i+1])/2. for i in range(len(energy_array)-1)])
+        bin_edges = np.linspace(np.maximum(Ei-energy_loss_ten_mfp, minimum_saved_energy), Ei, 11, axis=-1)
+        bin_weights = self._integrate_dark_rate(self._dark_ann_integrand, bin_edges[:,:-1].ravel(), bin_edges[:,1:].ravel(), np.repeat(Ei, 10), "DarkAnn", -11)
 
-        darkann_weights = np.array([quad(self._dark_ann_integrand, energy_array[i], energy_array[i+1], args=(Ei), full_output=1)[0] for i in range(len(energy_array)-1)])
+        resonant_bin_center = 0.5*(self._resonant_annihilation_energy + np.minimum(minimum_saved_energy, Ei))
+        weight_analytic = self._dark_ann_analytic_weight(Ei)
 
-        resonant_bin_center = 0.5*(self._resonant_annihilation_energy + np.min([minimum_saved_energy, Ei]))
-        sMAX = 2*(m_electron*np.min([minimum_saved_energy, Ei]) + m_electron**2)
-        beta = (2.*alpha_em/np.pi) * (np.log(sMAX/m_electron**2) - 1.)
-        dEdxT_GeVpercm = self.get_material_properties()[3]*(0.1)*cmtom #Converting MeV/cm to GeV/m to GeV/cm
-        weight_analytic = (1/dEdxT_GeVpercm)*(2*np.pi**2*alpha_em/m_electron)*(self.get_n_targets()[1])*GeVsqcm2*(sMAX - self._mV**2)**beta*self._positron_exponential_factor(self._resonant_annihilation_energy, Ei)
+        darkann_weights[above_resonance] = np.concatenate([weight_analytic[:,None], np.reshape(bin_weights, (len(Ei), 10))], axis=1)
+        energy_center_array[above_resonance] = np.concatenate([resonant_bin_center[:,None], 0.5*(bin_edges[:,:-1] + bin_edges[:,1:])], axis=1)
+        energy_array[above_resonance] = np.concatenate([np.full((len(Ei), 1), self._resonant_annihilation_energy), np.minimum(minimum_saved_energy, Ei)[:,None], bin_edges], axis=1)
+        return energy_center_array, darkann_weights, energy_array
 
-        darkann_weights = np.concatenate([[weight_analytic], darkann_weights])
-        energy_center_array = np.concatenate([[resonant_bin_center], energy_center_array])
-        energy_array = np.concatenate([[self._resonant_annihilation_energy, np.min([minimum_saved_energy, Ei])], energy_array])
+    def _d_rate_d_E_elec_brem(self, Ei):
+        energy_center_array, brem_elec_weights, energy_array = self._d_rate_d_E_brem_batch([Ei], 11)
+        return np.transpose([energy_center_array[0], brem_elec_weights[0]])
+    
+    def _d_rate_d_E_positron_brem(self, Ei):
+        energy_center_array, brem_positron_weights, energy_array = self._d_rate_d_E_brem_batch([Ei], -11)
+        return np.transpose([energy_center_array[0], brem_positron_weights[0]])
 
-        return [np.transpose([energy_center_array, darkann_weights]), energy_array]
+    def _d_rate_d_E_positron_ann(self, Ei):
+        if Ei < self._resonant_annihilation_energy:
+            return [[[0., 0.]], [0., 1.]]
+        energy_center_array, darkann_weights, energy_array = self._d_rate_d_E_positron_ann_batch([Ei])
+        return [np.transpose([energy_center_array[0], darkann_weights[0]]), energy_array[0]]
     
     def _d_rate_d_E_elec_brem_array(self):
         Ei_samp = np.transpose(self.get_DarkBremXSec())[0]
-        return {Ei:self._d_rate_d_E_elec_brem(Ei) for Ei in Ei_samp}
+        energy_center_array, brem_elec_weights, energy_array = self._d_rate_d_E_brem_batch(Ei_samp, 11)
+        return {'energies':Ei_samp, 'bin_energies':energy_center_array, 'rates':brem_elec_weights}
     def _d_rate_d_E_positron_brem_array(self):
         Ei_samp = np.transpose(self.get_DarkBremXSec())[0]
-        return {Ei:self._d_rate_d_E_positron_brem(Ei) for Ei in Ei_samp}
+        energy_center_array, brem_positron_weights, energy_array = self._d_rate_d_E_brem_batch(Ei_samp, -11)
+        return {'energies':Ei_samp, 'bin_energies':energy_center_array, 'rates':brem_positron_weights}
     def _d_rate_d_E_positron_ann_array(self):
         Ei_samp = np.transpose(self.get_DarkAnnXSec())[0]
-        return {Ei:self._d_rate_d_E_positron_ann(Ei)[0] for Ei in Ei_samp}
+        energy_center_array, darkann_weights, energy_array = self._d_rate_d_E_positron_ann_batch(Ei_samp)
+        return {'energies':Ei_samp, 'bin_energies':energy_center_array, 'rates':darkann_weights}
 
     def set_drate_dE(self):
         dict_dir = self.get_dark_dict_dir()
-        drate_file_name = dict_dir + "dark_drate.pkl"
-
-        files_set = False
-        outer_dict = {}
-        if os.path.exists(drate_file_name):
-            sample_file=open(drate_file_name, 'rb')
-            outer_dict=pickle.load(sample_file)
-            sample_file.close()
-            if self._mV_estimator in outer_dict.keys():
-                if self._target_material in outer_dict[self._mV_estimator].keys():
-                    d_rate_dict_elec_brem = outer_dict[self._mV_estimator][self._target_material]['brem_elec_drate']
-                    d_rate_dict_positron_brem = outer_dict[self._mV_estimator][self._target_material]['brem_positron_drate']
-                    d_rate_dict_positron_ann = outer_dict[self._mV_estimator][self._target_material]['annihilation_drate']
-                    files_set = True
-        if files_set == False:
+        d_rate = load_dark_table(dict_dir, "dark_drate", self._mV_estimator, self._target_material)
+        if d_rate is not None:
+            d_rate_dict_elec_brem = d_rate['brem_elec_drate']
+            d_rate_dict_positron_brem = d_rate['brem_positron_drate']
+            d_rate_dict_positron_ann = d_rate['annihilation_drate']
+        else:
             print("dRate not previously calculated, calculating now...")
-            d_rate_dict_elec_brem = self._d_rate_d_E_elec_brem_array()
-            d_rate_dict_positron_brem = self._d_rate_d_E_positron_brem_array()
-            d_rate_dict_positron_ann = self._d_rate_d_E_positron_ann_array()
-            if self._mV_estimator not in outer_dict.keys():
-                outer_dict[self._mV_estimator] = {}
-            outer_dict[self._mV_estimator][self._target_material] = {'brem_elec_drate':d_rate_dict_elec_brem,
-                                                                     'brem_positron_drate':d_rate_dict_positron_brem,
-                                                                     'annihilation_drate':d_rate_dict_positron_ann}
-            sample_file=open(drate_file_name, 'wb')
-            pickle.dump(outer_dict, sample_file)
-            sample_file.close()
-
-        self._d_rate_dict_elec_brem = d_rate_dict_elec_brem
-        self._d_rate_dict_positron_brem = d_rate_dict_positron_brem
-        self._d_rate_dict_positron_ann = d_rate_dict_positron_ann
+            d_rate_dict_elec_brem = drate_arrays(self._d_rate_d_E_elec_brem_array())
+            d_rate_dict_positron_brem = drate_arrays(self._d_rate_d_E_positron_brem_array())
+            d_rate_dict_positron_ann = drate_arrays(self._d_rate_d_E_positron_ann_array())
+            save_dark_table(dict_dir, "dark_drate", self._mV_estimator, self._target_material,
+                            {'brem_elec_drate':d_rate_dict_elec_brem,
+                             'brem_positron_drate':d_rate_dict_positron_brem,
+                             'annihilation_drate':d_rate_dict_positron_ann})
+
+        # tables saved by earlier versions as dicts keyed by energy are converted here
+        self._d_rate_table_elec_brem = drate_sampling_table(d_rate_dict_elec_brem)
+        self._d_rate_table_positron_brem = drate_sampling_table(d_rate_dict_positron_brem)
+        self._d_rate_table_positron_ann = drate_sampling_table(d_rate_dict_positron_ann)
+
+    def _drate_nodes(self, table, E0):
+        """Index of the closest lesser saved energy Ei in a dRate/dE table for each energy E0 (clipped to the table range)"""
+        return np.clip(np.searchsorted(table['energies'], E0, side='right') - 1, 0, len(table['energies']) - 1)
+
+    def _drate_table(self, PID, process):
+        """dRate/dE sampling table used by produce_bsm_particle for a parent PID and process, None if there is none"""
+        if process == "DarkAnn" and PID == -11:
+            return self._d_rate_table_positron_ann
+        elif process == "DarkBrem":
+            if PID == 11:
+                return self._d_rate_table_elec_brem
+            else:
+                return self._d_rate_table_positron_brem
+        return None
+
+    def draw_interaction_energies(self, table, E0):
+        """Draws the energies at which particles of energy E0 produce a dark vector, 
+        using the dRate/dE table of the closest lesser saved energy Ei (clipped to the table range)
+        and correcting for the difference E0 - Ei.
+        Args:
+            table: dRate/dE sampling table (see drate_sampling_table)
+            E0: scalar or array of particle energies in GeV
+        Returns:
+            array of interaction energies, nan where the rate vanishes
+        """
+        E0 = np.atleast_1d(np.asarray(E0, dtype=float))
+        node = self._drate_nodes(table, E0)
+        E_interact = np.full(len(E0), np.nan)
+        valid = table['total'][node] > 0.0
+        node = node[valid]
+        draws = np.random.random(len(node))
+        bins = np.sum(table['cdf'][node] <= draws[:,None], axis=1)
+        E_interact[valid] = table['bin_energies'][node, bins] + (E0[valid] - table['energies'][node])
+        return E_interact
 
     def GetBSMWeights(self, particle, process):
         if type(particle) == list or type(particle) == np.ndarray:
             PID, energy_initial = particle
         else:
-            PID, energy_initial = particle.get_ids()["PID"], particle.get_p0()[0]
+            PID, energy_initial = particle.PID, particle.get_p0()[0]
         if process not in (self._minimum_calculable_dark_energy[PID]).keys():
             return 0.0
         if energy_initial < self._minimum_calculable_dark_energy[PID][process]:
@@ -393,10 +612,7 @@ class DarkShower(Shower):
                 return (self.g_e**2/(4*np.pi*alpha_em))*self._brem_positron_numerical_weight(energy_initial)
         if PID == -11 and process == "DarkAnn":
             minimum_saved_energy = self.get_DarkAnnXSec()[0][0]
-            sMAX = 2*(m_electron*np.min([minimum_saved_energy, energy_initial]) + m_electron**2)
-            beta = (2.*alpha_em/np.pi) * (np.log(sMAX/m_electron**2) - 1.)
-            dEdxT_GeVpercm = self.get_material_properties()[3]*(0.1)*cmtom #Converting MeV/cm to GeV/m to GeV/cm
-            weight_analytic = (1/dEdxT_GeVpercm)*(2*np.pi**2*alpha_em/m_electron)*(self.get_n_targets()[1])*GeVsqcm2*(sMAX - self._mV**2)**beta*self._positron_exponential_factor(self._resonant_annihilation_energy, energy_initial)
+            weight_analytic = self._dark_ann_analytic_weight(energy_initial)
             if energy_initial > minimum_saved_energy:
                 weight_numerical = self._annihilation_numerical_weight(energy_initial)
             else:
@@ -405,15 +621,129 @@ class DarkShower(Shower):
             return (self.g_e**2/(4*np.pi*alpha_em))*(weight_numerical + weight_analytic)
         if PID == 111 or PID == 221 or PID == 331:
             if process == "TwoBody_BSMDecay":
-                mass_ratio = self._mV/particle.get_ids()["mass"]
+                mass_ratio = self._mV/particle.mass
                 if mass_ratio >= 1.0:
                     return 0.0
-                return 2*(self.kinetic_mixing)**2*(1.0 - mass_ratio**2)**3*meson_twobody_branchingratios[particle.get_ids()["PID"]]
+                return 2*(self.kinetic_mixing)**2*(1.0 - mass_ratio**2)**3*meson_twobody_branchingratios[particle.PID]
             else:
                 return 0.0
         else:
             return 0.0
 
+    def _dark_ann_analytic_weight(self, energy_initial):
+        """Weight of resonant annihilation in the bin [resonant energy, minimum saved energy],
+        accepts scalar or array positron energies above the resonant energy"""
+        minimum_saved_energy = self.get_DarkAnnXSec()[0][0]
+        sMAX = 2*(m_electron*np.minimum(minimum_saved_energy, energy_initial) + m_electron**2)
+        beta = (2.*alpha_em/np.pi) * (np.log(sMAX/m_electron**2) - 1.)
+        dEdxT_GeVpercm = self.get_material_properties()[3]*(0.1)*cmtom #Converting MeV/cm to GeV/m to GeV/cm
+        return (1/dEdxT_GeVpercm)*(2*np.pi**2*alpha_em/m_electron)*(self.get_n_targets()[1])*GeVsqcm2*(sMAX - self._mV**2)**beta*self._positron_exponential_factor(self._resonant_annihilation_energy, energy_initial)
+
+    def GetBSMWeights_batch(self, PIDs, energies, masses=None, processes=None):
+        """ Vectorized version of GetBSMWeights for many particles and processes at once.
+        Args:
+            PIDs: array of particle IDs
+            energies: array of particle energies in GeV
+            masses: array of particle masses in GeV (only used for meson decays), 
+            if None the masses of mass_dict are used
+            processes: list of dark process codes, defaults to the active processes
+        Returns:
+            (N, n_processes) array of weights, columns ordered as processes
+        """
+        PIDs = np.asarray(PIDs)
+        energies = np.asarray(energies, dtype=float)
+        if processes is None:
+            processes = self.active_processes
+        coupling_factor = self.g_e**2/(4*np.pi*alpha_em)
+
+        weights = np.zeros((len(PIDs), len(processes)))
+        for jj, process in enumerate(processes):
+            if process == "DarkBrem":
+                for PID, numerical_weight in ((11, self._brem_elec_numerical_weight), (-11, self._brem_positron_numerical_weight)):
+                    selection = (PIDs == PID) & (energies >= self._minimum_calculable_dark_energy[PID]["DarkBrem"])
+                    weights[selection, jj] = coupling_factor*numerical_weight(energies[selection])
+            elif process == "DarkAnn":
+                selection = (PIDs == -11) & (energies >= self._resonant_annihilation_energy)
+                weights[selection, jj] = coupling_factor*(self._annihilation_numerical_weight(energies[selection])
+                                                          + self._dark_ann_analytic_weight(energies[selection]))
+            elif process == "DarkComp":
+                selection = (PIDs == 22) & (energies >= self._minimum_calculable_dark_energy[22]["DarkComp"])
+                E_sel = energies[selection]
+                weights[selection, jj] = coupling_factor*self._NSigmaDarkComp(E_sel)/(self._NSigmaPP(E_sel) + self._NSigmaComp(E_sel))
+            elif process == "TwoBody_BSMDecay":
+                for PID, branching_ratio in meson_twobody_branchingratios.items():
+                    selection = (PIDs == PID)
+                    if masses is None:
+                        mass_ratio = np.full(np.sum(selection), self._mV/mass_dict[PID])
+                    else:
+                        mass_ratio = self._mV/np.asarray(masses, dtype=float)[selection]
+                    weights[selection, jj] = np.where(mass_ratio < 1.0, 2*(self.kinetic_mixing)**2*(1.0 - np.minimum(mass_ratio, 1.0)**2)**3*branching_ratio, 0.0)
+        return weights
+
+    def _shower_columns(self, shower):
+        """Returns the arrays of PIDs, initial energies, masses and weights of a list of Particle objects 
+        or a ParticleTable"""
+        if type(shower) == ParticleTable:
+            PIDs = shower.PID
+            masses = np.array([mass_dict.get(PID, 0.0) for PID in PIDs]) if len(shower) > 0 else np.zeros(0)
+            masses = np.where(np.isnan(shower.mass), masses, shower.mass)
+            return PIDs, shower.p0[:,0], masses, shower.weight
+        PIDs = np.array([ap.PID for ap in shower])
+        energies = np.array([ap.get_p0()[0] for ap in shower])
+        masses = np.array([mass_dict.get(ap.PID, 0.0) if ap.mass is None else ap.mass for ap in shower])
+        weights = np.array([ap.weight for ap in shower])
+        return PIDs, energies, masses, weights
+
+    def shower_BSM_weights(self, shower):
+        """ Returns the (N, n_active_processes) matrix of GetBSMWeights_batch for a 
+        list of Particle objects (or a ParticleTable)"""
+        PIDs, energies, masses, weights = self._shower_columns(shower)
+        return self.GetBSMWeights_batch(PIDs, energies, masses=masses)
+
+    def dark_yield(self, ExDir=None, SParams=None, energy_bins=None):
+        """ Total dark photon weights produced by an SM shower (or a batch of showers), without 
+        sampling the dark photon kinematics. The totals are not restricted to a detector set with 
+        set_detector: without a detector they equal the summed weights of the dark photons produced by 
+        generate_dark_shower from the same SM particles, with one they include the dark photons missing it.
+        Args:
+            ExDir: path to file containing existing SM shower, an actual shower (list of Particle objects 
+            or ParticleTable), or a batch of showers (list of lists of Particle objects or a 
+            concatenated ParticleTable)
+            SParams: if no ExDir provided, incident particle of a new SM shower to generate, 
+            consisting of a "Particle" object
+            energy_bins: optional bin edges in parent energy (GeV) for histograms of the weights
+        Returns:
+            totals: dictionary {process: {parent PID: total weight}}
+            if energy_bins is given, [totals, histograms] where histograms is a dictionary 
+            {process: {parent PID: array of summed weights in each parent energy bin}}
+        """
+        if type(ExDir) == list and len(ExDir) > 0 and type(ExDir[0]) == list:
+            ExDir = [ap for shower in ExDir for ap in shower]
+        if type(ExDir) == ParticleTable:
+            shower = ExDir
+        else:
+            shower = self.sm_shower_to_sample(ExDir, SParams)
+            if shower is None:
+                return None
+        PIDs, energies, masses, parent_weights = self._shower_columns(shower)
+        weights = self.GetBSMWeights_batch(PIDs, energies, masses=masses)*parent_weights[:,None]
+
+        totals, histograms = {}, {}
+        for jj, process in enumerate(self.active_processes):
+            totals[process], histograms[process] = {}, {}
+            for PID in np.unique(PIDs[weights[:,jj] > 0.0]):
+                selection = (PIDs == PID) & (weights[:,jj] > 0.0)
+                # as in produce_bsm_particle, no dark photon is produced where the dRate/dE table vanishes
+                drate_table = self._drate_table(PID, process)
+                if drate_table is not None:
+                    selection[selection] = drate_table['total'][self._drate_nodes(drate_table, energies[selection])] > 0.0
+                totals[process][int(PID)] = float(np.sum(weights[selection, jj]))
+                if energy_bins is not None:
+                    histograms[process][int(PID)] = np.histogram(energies[selection], bins=energy_bins, weights=weights[selection, jj])[0]
+        if energy_bins is not None:
+            return totals, histograms
+        return totals
+
     def draw_dark_sample(self,Einc,LU_Key=-1,process="DarkBrem",VB=False):
         dark_sample_list=self._loaded_dark_samples 
         if LU_Key<0 or LU_Key > len(dark_sample_list[process]):
@@ -434,6 +764,7 @@ class DarkShower(Shower):
         integrand = dark_sample_dict["adaptive_map"]
         max_F      = dark_sample_dict["max_F"][self._target_material]*self._maxF_fudge_global
         neval_vegas= dark_sample_dict["neval"]
+        import vegas as vg
         integrand=vg.Integrator(map=integrand, max_nhcube=1, neval=neval_vegas)
 
         event_info={'E_inc': Einc, 'm_e': m_electron, 'Z_T': self._ZTarget, 'A_T':self._ATarget, 'mT':self._ATarget, 'alpha_FS': alpha_em, 'mV': self._mV, 'Eg_min':self._Egamma_min}
@@ -449,11 +780,17 @@ class DarkShower(Shower):
         sample_found = False
         while sample_found is False and n_integrators_used < self._max_n_integrators:
             n_integrators_used += 1
-            for x,wgt in integrand.random():
-                if VB:
-                    sampcount += 1  
-                if  max_F*draw_U()<wgt*diff_xsec_func(event_info,x):
-                    sample_found = True
+            for x_batch, wgt_batch in integrand.random_batch():
+                # VEGAS returns the points of a batch ordered by hypercube, so they are tried in random 
+                # order: otherwise the first accepted point is biased towards the first hypercubes
+                for ii in np.random.permutation(len(wgt_batch)):
+                    if VB:
+                        sampcount += 1  
+                    if  max_F*draw_U()<wgt_batch[ii]*diff_xsec_func(event_info,x_batch[ii]):
+                        x = np.array(x_batch[ii])
+                        sample_found = True
+                        break
+                if sample_found:
                     break
         if sample_found is False:
             raise Exception("No Sample Found", process, Einc, LU_Key)
@@ -462,108 +799,471 @@ class DarkShower(Shower):
         else:
             return(x)
 
-    def produce_bsm_particle(self, p_original, process, weight=None, VB=False):
-        p0 = deepcopy(p_original)
+    def draw_dark_samples(self, Einc, process="DarkBrem", cos_theta_min=None):
+        """ Draws one unweighted dark sample for each energy of Einc. Energies that share a
+        saved adaptive map (as chosen by draw_dark_sample) are drawn together: the points of each
+        VEGAS batch are dealt out among the energies still lacking a sample and the cross section
+        is evaluated on each energy's share at once, so every sample uses its own proposals. As in 
+        draw_dark_sample, the points of a batch are shuffled before they are dealt out.
+
+        If cos_theta_min is given, sample i is restricted to dark vectors with 
+        dark_vector_cos_theta >= cos_theta_min[i]. The fraction of the cross section inside the 
+        restricted region is estimated for each energy from a separate VEGAS batch (with a non-zero rate), 
+        so that it is independent of the sample. Energies for which no point of that batch lies inside 
+        the region get a fraction of zero and no sample (nan).
+        Args:
+            Einc: array of incident energies in GeV
+            process: dark process code
+            cos_theta_min: optional array of the smallest allowed cosine of the dark vector angle for each energy
+        Returns:
+            (len(Einc), dim) array of samples, and (if cos_theta_min is given) the array of fractions
+        """
+        import vegas as vg
+        if process in diff_xsection_batch_options:
+            diff_xsec_func = diff_xsection_batch_options[process]
+        else:
+            raise Exception("Your process is not in the list")
+
+        Einc = np.atleast_1d(np.asarray(Einc, dtype=float))
+        dark_sample_list = self._loaded_dark_samples[process]
+        energies = np.array([x[0] for x in dark_sample_list])
+        LU_Keys = np.clip(np.argmin(np.abs(energies[np.newaxis,:] - Einc[:,np.newaxis]), axis=1) + 1, 0, len(dark_sample_list) - 1)
+
+        samples, fractions = None, np.ones(len(Einc))
+        for LU_Key in np.unique(LU_Keys):
+            dark_sample_dict = dark_sample_list[LU_Key][1]
+            max_F = dark_sample_dict["max_F"][self._target_material]*self._maxF_fudge_global
+            integrand = vg.Integrator(map=dark_sample_dict["adaptive_map"], max_nhcube=1, neval=dark_sample_dict["neval"])
+            if samples is None:
+                samples = np.full((len(Einc), integrand.dim), np.nan)
+
+            pending = list(np.flatnonzero(LU_Keys == LU_Key))
+            if cos_theta_min is not None:
+                for row in pending:
+                    if cos_theta_min[row] <= -1.0:
+                        continue
+                    # batches are drawn until one has a non-zero rate
+                    rate_total, rate_inside, n_batches = 0.0, 0.0, 0
+                    while rate_total == 0.0 and n_batches < self._max_n_integrators:
+                        n_batches += 1
+                        x, wgt = next(iter(integrand.random_batch()))
+                        rates = wgt*diff_xsec_func(self._dark_event_info(Einc[row]), x)
+                        inside = dark_vector_cos_theta(process, Einc[row], x, self._mV) >= cos_theta_min[row]
+                        rate_total, rate_inside = np.sum(rates), np.sum(rates[inside])
+                    fractions[row] = rate_inside/rate_total if rate_total > 0.0 else 0.0
+                pending = [row for row in pending if fractions[row] > 0.0]
+            n_integrators_used = 0
+            while len(pending) > 0 and n_integrators_used < self._max_n_integrators:
+                n_integrators_used += 1
+                for x, wgt in integrand.random_batch():
+                    order = np.random.permutation(len(wgt))
+                    x, wgt = x[order], wgt[order]
+                    still_pending = []
+                    for jj, row in enumerate(pending):
+                        x_row, wgt_row = x[jj::len(pending)], wgt[jj::len(pending)]
+                        if len(wgt_row) == 0:
+                            still_pending.append(row)
+                            continue
+                        rates = wgt_row*diff_xsec_func(self._dark_event_info(Einc[row]), x_row)
+                        if cos_theta_min is not None:
+                            rates[dark_vector_cos_theta(process, Einc[row], x_row, self._mV) < cos_theta_min[row]] = 0.0
+                        accepted = max_F*draw_U(len(wgt_row)) < rates
+                        if np.any(accepted):
+                            samples[row] = x_row[np.argmax(accepted)]
+                        else:
+                            still_pending.append(row)
+                    pending = still_pending
+                    if len(pending) == 0:
+                        break
+            if len(pending) > 0:
+                raise Exception("No Sample Found", process, Einc[pending], LU_Key)
+        if cos_theta_min is not None:
+            return samples, fractions
+        return samples
+
+    def _dark_event_info(self, Einc):
+        """Parameters of the dark differential cross sections for an incident energy Einc"""
+        return {'E_inc': Einc, 'm_e': m_electron, 'Z_T': self._ZTarget, 'A_T':self._ATarget, 'mT':self._ATarget,
+                'alpha_FS': alpha_em, 'mV': self._mV, 'Eg_min':self._Egamma_min}
+
+    def produce_bsm_particle(self, p0, process, weight=None, VB=False):
+        """ Produces a dark vector from the SM particle p0 through process. The energy loss and 
+        multiple scattering of p0 before the emission are applied to a new four-momentum, 
+        p0 itself is neither copied nor modified.
+        Args:
+            p0: Particle object from the SM shower
+            process: dark process code
+            weight: weight of the emission, computed with GetBSMWeights if None
+        Returns:
+            dark vector Particle object, or None if the emission rate vanishes
+            (or, with a detector, if the dark vector cannot reach it)
+        """
+        if self._detector is not None:
+            dark_particles = self.produce_bsm_particles(p0, process, weight=weight, n_emissions=1)
+            return dark_particles[0] if len(dark_particles) > 0 else None
+
         if weight == None:
             wg = self.GetBSMWeights(p0, process)
         else:
             wg = weight
 
-        dict_samp = None
-        if process == "DarkAnn" and p0.get_ids()["PID"] == -11:
-            dict_samp = self._d_rate_dict_positron_ann
-        elif process == "DarkBrem":
-            if p0.get_ids()["PID"] == 11:
-                dict_samp = self._d_rate_dict_elec_brem
-            else:
-                dict_samp = self._d_rate_dict_positron_brem
-        if dict_samp is not None:
-            energies_saved = np.array(list(dict_samp.keys()))
-
+        drate_table = self._drate_table(p0.PID, process)
+        p_emit = p0.get_pf()
+        if drate_table is not None:
             E0 = p0.get_p0()[0]
-            if E0 < np.min(energies_saved):
-                Ei = np.min(energies_saved)
-            elif E0 > np.max(energies_saved):
-                Ei = np.max(energies_saved)
-            else:
-                Ei = np.max([Ei for Ei in energies_saved if Ei <= E0])
-            energies, relative_probabilities = np.transpose(dict_samp[Ei])
-            if np.sum(relative_probabilities) == 0.0:
+            E_interact = self.draw_interaction_energies(drate_table, E0)[0]
+            if np.isnan(E_interact):
                 return None
-            relative_probabilities = relative_probabilities/np.sum(relative_probabilities)
-            E_interact = np.random.choice(energies, p=relative_probabilities) + (E0-Ei) #correct for difference between true energy and energy for which samples were saved
             dEdxT = self.get_material_properties()[3]*(0.1)
             dist = (p0.get_p0()[0] - E_interact)/dEdxT
             p_scat = self._get_MCS_p(p0.get_p0(), self._rhoTarget*(dist/cmtom),
                                      self._ATarget, self._ZTarget,
                                      self._MCS_rescale_factor)
-            p0.set_pf(p_scat)
-            p0.lose_energy(E0 - E_interact)
+            p_emit = energy_loss_fourvector(p_scat, p0.mass, E0 - E_interact)
 
-        E0 = p0.get_pf()[0]
-        RM = p0.rotation_matrix()
+        E0 = p_emit[0]
+        RM = rotation_matrix(p_emit)
 
         if process == "DarkAnn" and E0 < self.get_DarkAnnXSec()[0][0]:
             EVf, pVxfZF, pVyfZF, pVzfZF = self._resonant_annihilation_energy, 0, 0, np.sqrt(self._resonant_annihilation_energy**2 - self._mV**2)
         else:
             sample_event = self.draw_dark_sample(E0, process=process, VB=VB)
             #dark-production is estabilished such that the last particle returned corresponds to the dark vector
-            EVf, pVxfZF, pVyfZF, pVzfZF = dark_kinematic_function[process](p0, sample_event, mV=self._mV)[-1] 
+            EVf, pVxfZF, pVyfZF, pVzfZF = dark_kinematic_function_batch[process]([E0], [sample_event], mV=self._mV)[0,-1] 
         pV4LF = np.concatenate([[EVf], np.dot(RM, [pVxfZF, pVyfZF, pVzfZF])])
 
-        init_IDs = p0.get_ids()
         V_dict = {}
         V_dict["PID"] = 4900022
-        V_dict["parent_PID"] = init_IDs["PID"]
-        V_dict["ID"] = 2*(init_IDs["ID"]) + 0
-        V_dict["parent_ID"] = init_IDs["ID"]
-        V_dict["generation_number"] = init_IDs["generation_number"] + 1
+        V_dict["parent_PID"] = p0.PID
+        V_dict["ID"] = 2*(p0.ID) + 0
+        V_dict["parent_ID"] = p0.ID
+        V_dict["generation_number"] = p0.generation_number + 1
         V_dict["generation_process"] = process
-        V_dict["weight"] = wg*init_IDs["weight"]
+        V_dict["weight"] = wg*p0.weight
 
         return Particle(pV4LF, p0.get_rf(), V_dict)
 
-    def generate_dark_shower(self, ExDir=None, SParams=None):
-        """ Process an existing SM shower (or produce a new one) by interating 
-        through its particles and generating possible dark photon emissions using 
-        all available processes.
+    def produce_bsm_particles(self, p0, process, weight=None, n_emissions=1):
+        """ Produces n_emissions independent dark vectors from the SM particle p0 through process,
+        each carrying 1/n_emissions of the emission weight (split_factor = n_emissions).
+        The interaction energies and the dark samples of all emissions are drawn as batches.
+        With a detector (see set_detector), the dark vector directions are restricted to those that 
+        can cross it and the weights are multiplied by the fraction of the emission rate they cover.
         Args:
-            ExDir: path to file containing existing SM shower OR an actual shower (list of Particle objects)
-            SParamas: if no path provided, incident particle of a new SM shower to generate, 
+            p0: Particle object from the SM shower
+            process: dark process code
+            weight: weight of the emission, computed with GetBSMWeights if None
+            n_emissions: number of dark vectors to draw
+        Returns:
+            list of dark vector Particle objects, empty if the emission rate vanishes
+            (with a detector, emissions that cannot reach it are left out)
+        """
+        if weight == None:
+            wg = self.GetBSMWeights(p0, process)
+        else:
+            wg = weight
+
+        drate_table = self._drate_table(p0.PID, process)
+        if drate_table is not None:
+            E0 = p0.get_p0()[0]
+            E_interact = self.draw_interaction_energies(drate_table, np.full(n_emissions, E0))
+            if np.any(np.isnan(E_interact)):
+                return []
+            dEdxT = self.get_material_properties()[3]*(0.1)
+            p_emit = []
+            for E_int in E_interact:
+                dist = (E0 - E_int)/dEdxT
+                p_scat = self._get_MCS_p(p0.get_p0(), self._rhoTarget*(dist/cmtom),
+                                         self._ATarget, self._ZTarget,
+                                         self._MCS_rescale_factor)
+                p_emit.append(energy_loss_fourvector(p_scat, p0.mass, E0 - E_int))
+            p_emit = np.array(p_emit)
+        else:
+            p_emit = np.tile(p0.get_pf(), (n_emissions, 1))
+
+        pV4ZF = np.empty((n_emissions, 4))
+        if process == "DarkAnn":
+            # below the lowest saved energy the annihilation is resonant
+            resonant = p_emit[:,0] < self.get_DarkAnnXSec()[0][0]
+            pV4ZF[resonant] = [self._resonant_annihilation_energy, 0, 0, np.sqrt(self._resonant_annihilation_energy**2 - self._mV**2)]
+        else:
+            resonant = np.zeros(n_emissions, dtype=bool)
+        fractions = np.ones(n_emissions)
+        if np.any(~resonant):
+            if self._detector is None:
+                sample_events = self.draw_dark_samples(p_emit[~resonant,0], process=process)
+            else:
+                cos_theta_min = self._detector_cos_theta_min(p_emit[~resonant], p0.get_rf())
+                sample_events, fractions[~resonant] = self.draw_dark_samples(p_emit[~resonant,0], process=process, cos_theta_min=cos_theta_min)
+            #dark-production is estabilished such that the last particle returned corresponds to the dark vector
+            pV4ZF[~resonant] = dark_kinematic_function_batch[process](p_emit[~resonant,0], sample_events, mV=self._mV)[:,-1]
+
+        dark_particles = []
+        for p_emit_k, pV4ZF_k, fraction in zip(p_emit, pV4ZF, fractions):
+            if fraction == 0.0:
+                continue
+            pV4LF = np.concatenate([[pV4ZF_k[0]], np.dot(rotation_matrix(p_emit_k), pV4ZF_k[1:])])
+            V_dict = {"PID":4900022, "parent_PID":p0.PID, "ID":2*(p0.ID) + 0, "parent_ID":p0.ID,
+                      "generation_number":p0.generation_number + 1, "generation_process":process,
+                      "weight":wg*p0.weight*fraction/n_emissions, "split_factor":n_emissions}
+            dark_particles.append(Particle(pV4LF, p0.get_rf(), V_dict))
+        return dark_particles
+
+    def sm_shower_to_sample(self, ExDir=None, SParams=None):
+        """ Returns the SM shower to be reprocessed into dark particles.
+        Args:
+            ExDir: path to file containing existing SM shower OR an actual shower (list of Particle objects or ParticleTable)
+            SParams: if no path provided, incident particle of a new SM shower to generate, 
             consisting of a "Particle" object
         Returns:
-            [ShowerToSamp, NewShower]: where ShowerToSamp is the initial SM shower and NewShower 
-            is the list of possible dark photon emissions generated from it
+            list of Particle objects, or None if neither ExDir nor SParams is provided
         """
         if ExDir is None and SParams is None:
             print("Need an existing SM shower-file directory or SM incident particle to run dark shower")
             return None
         
         if ExDir is not None and type(ExDir)==str:
-            ShowerToSamp = np.load(ExDir, allow_pickle=True)
+            return np.load(ExDir, allow_pickle=True)
         elif ExDir is not None and type(ExDir)==list:
-            ShowerToSamp = ExDir
+            return ExDir
+        elif ExDir is not None and type(ExDir)==ParticleTable:
+            return ExDir.to_particles()
         elif type(SParams)==Particle:
-            ShowerToSamp = self.generate_shower(SParams)
+            return self.generate_shower(SParams)
         else:
             raise ValueError("Provided SParams must be a `Particle' class object")
 
-        NewShower = []
-        for ap in ShowerToSamp:
-            for process_code in self.active_processes:
+    def meson_dark_decays(self, mesons, PIDs=None, n_oversample=1):
+        """ Vectorized TwoBody_BSMDecay of many mesons at once (e.g. a pi0 beam or the mesons of a shower).
+        The weights follow GetBSMWeights (from meson_twobody_branchingratios) and the gamma + V decays
+        of all mesons are sampled with a single vectorized boost (see two_body_decay_batch).
+        Args:
+            mesons: list of Particle objects, ParticleTable, or (N,4) array of meson four-momenta (a beam file),
+            rows that are not pi0/eta/eta' or lighter than the dark vector are skipped
+            PIDs: PDG IDs of the mesons (one value or an (N,) array), only used for arrays of four-momenta,
+            whose mesons are treated as incident particles of separate events
+            n_oversample: number of dark photons drawn per meson, each with 1/n_oversample of the weight
+        Returns:
+            ParticleTable of the dark photons (parent_index is -1, parents are not part of the table)
+        """
+        if type(mesons) == ParticleTable:
+            parents = mesons[np.isin(mesons.PID, list(meson_twobody_branchingratios.keys()))]
+        elif type(mesons) == list:
+            parents = ParticleTable.from_particles([ap for ap in mesons if ap.PID in meson_twobody_branchingratios])
+        else:
+            if PIDs is None:
+                raise ValueError("PIDs must be provided for an array of meson four-momenta")
+            four_momenta = np.atleast_2d(np.asarray(mesons, dtype=float))
+            PIDs = np.broadcast_to(PIDs, (len(four_momenta),))
+            parents = ParticleTable(p0=four_momenta, pf=four_momenta, PID=PIDs,
+                                    ID=np.full(len(four_momenta), 1, dtype=object),
+                                    event_index=np.arange(len(four_momenta)))
+
+        parent_PIDs, energies, masses, parent_weights = self._shower_columns(parents)
+        weights = self.GetBSMWeights_batch(parent_PIDs, energies, masses=masses, processes=["TwoBody_BSMDecay"])[:,0]
+        rows = np.repeat(np.flatnonzero(weights > 0.0), n_oversample)
+        if len(rows) == 0:
+            return ParticleTable()
+
+        pV4LF = two_body_decay_batch(parents.pf[rows], masses[rows], 0.0, self._mV)[1]
+        return ParticleTable(p0=pV4LF, pf=pV4LF, r0=parents.rf[rows], rf=parents.rf[rows],
+                             PID=np.full(len(rows), 4900022), ID=np.array([2*ID + 1 for ID in parents.ID[rows]], dtype=object),
+                             parent_PID=parent_PIDs[rows], parent_ID=parents.ID[rows],
+                             generation_number=parents.generation_number[rows] + 1,
+                             process_code=np.full(len(rows), generation_process_codes["TwoBody_BSMDecay"]),
+                             weight=parent_weights[rows]*weights[rows]/n_oversample,
+                             split_factor=np.full(len(rows), n_oversample),
+                             mass=np.full(len(rows), self._mV), event_index=parents.event_index[rows])
+
+    def _split_meson_decays(self, shower, weights, n_oversample=1):
+        """ Produces the TwoBody_BSMDecay dark photons of a shower with meson_dark_decays.
+        Returns:
+            the weights (shower_BSM_weights) with the TwoBody_BSMDecay column set to zero, 
+            and the ParticleTable of the meson decays
+        """
+        if "TwoBody_BSMDecay" not in self.active_processes:
+            return weights, ParticleTable()
+        weights = np.array(weights)
+        weights[:, list(self.active_processes).index("TwoBody_BSMDecay")] = 0.0
+        return weights, self.meson_dark_decays(shower, n_oversample=n_oversample)
+
+    def dark_emissions(self, ap, weights=None, n_oversample=1):
+        """ Generates the possible dark photon emissions of a single SM particle 
+        using all active processes.
+        Args:
+            ap: Particle object from the SM shower
+            weights: optional precomputed weights of ap for each active process 
+            (a row of shower_BSM_weights), computed with GetBSMWeights if None
+            n_oversample: number of dark photons drawn per process, each with 1/n_oversample of the weight
+        Returns:
+            list of dark photon Particle objects (n_oversample per process with non-zero weight)
+        """
+        dark_particles = []
+        for jj, process_code in enumerate(self.active_processes):
+            if weights is None:
                 wg = self.GetBSMWeights(ap, process=process_code)
-                if wg > 0.0:
-                    if process_code == "TwoBody_BSMDecay":
-                        gamma_dict = {"mass":0, "PID":22}
-                        V_dict = {"mass":self._mV, "PID":4900022,
-                                  "weight":ap.get_ids()["weight"]*wg,
-                                  "parent_PID":ap.get_ids()["PID"], "parent_ID":ap.get_ids()["ID"],
-                                  "ID":2*(ap.get_ids()["ID"])+1, "generation_number":ap.get_ids()["generation_number"]+1,
-                                  "generation_process":process_code}
-                        npart = ap.two_body_decay(gamma_dict, V_dict)[1]
-                        NewShower.append(npart)
-                    else:    
-                        npart = self.produce_bsm_particle(ap, process=process_code, weight=wg)
-                        if npart is not None:
-                            NewShower.append(npart)
-        return ShowerToSamp, NewShower
+            else:
+                wg = weights[jj]
+            if wg > 0.0 and n_oversample > 1:
+                if process_code == "TwoBody_BSMDecay":
+                    dark_particles.extend(self.meson_dark_decays([ap], n_oversample=n_oversample).to_particles())
+                else:
+                    dark_particles.extend(self.produce_bsm_particles(ap, process=process_code, weight=wg, n_emissions=n_oversample))
+            elif wg > 0.0:
+                if process_code == "TwoBody_BSMDecay":
+                    gamma_dict = {"mass":0, "PID":22}
+                    V_dict = {"mass":self._mV, "PID":4900022,
+                              "weight":ap.weight*wg,
+                              "parent_PID":ap.PID, "parent_ID":ap.ID,
+                              "ID":2*(ap.ID)+1, "generation_number":ap.generation_number+1,
+                              "generation_process":process_code}
+                    npart = ap.two_body_decay(gamma_dict, V_dict)[1]
+                    dark_particles.append(npart)
+                else:    
+                    npart = self.produce_bsm_particle(ap, process=process_code, weight=wg)
+                    if npart is not None:
+                        dark_particles.append(npart)
+        return dark_particles
+
+    def generate_dark_shower(self, ExDir=None, SParams=None, return_table=False, n_oversample=1):
+        """ Process an existing SM shower (or produce a new one) by interating 
+        through its particles and generating possible dark photon emissions using 
+        all available processes.
+        Args:
+            ExDir: path to file containing existing SM shower OR an actual shower (list of Particle objects or ParticleTable)
+            SParamas: if no path provided, incident particle of a new SM shower to generate, 
+            consisting of a "Particle" object
+            return_table: bool, if True both showers are returned as ParticleTables
+            n_oversample: number of dark photons drawn per (SM particle, process), each carrying 
+            1/n_oversample of the emission weight (recorded as their split_factor)
+        Returns:
+            [ShowerToSamp, NewShower]: where ShowerToSamp is the initial SM shower and NewShower 
+            is the list of possible dark photon emissions generated from it
+        """
+        ShowerToSamp = self.sm_shower_to_sample(ExDir, SParams)
+        if ShowerToSamp is None:
+            return None
+
+        NewShower, meson_decays = [], ParticleTable()
+        if len(ShowerToSamp) > 0:
+            weights, meson_decays = self._split_meson_decays(ShowerToSamp, self.shower_BSM_weights(ShowerToSamp), n_oversample)
+            # only particles with a non-zero weight for some process go on to kinematic sampling
+            for ii in np.flatnonzero(np.any(weights > 0.0, axis=1)):
+                NewShower.extend(self.dark_emissions(ShowerToSamp[ii], weights[ii], n_oversample=n_oversample))
+        if return_table:
+            return ParticleTable.from_particles(ShowerToSamp), ParticleTable.concatenate([ParticleTable.from_particles(NewShower), meson_decays], renumber_events=False)
+        return ShowerToSamp, NewShower + meson_decays.to_particles()
+
+
+class DarkShowerScan:
+    """ Reprocesses SM showers into dark photons for a list of dark vector masses at once.
+
+    The SM shower does not depend on the dark vector mass, so each SM shower is generated 
+    (or loaded) once and every one of its particles is passed through the dark tables 
+    (cross sections, weights, dRate/dE, samplers) of all masses in a single loop.
+    """
+
+    def __init__(self, dict_dir, target_material, min_energy, target_length, mV_list, 
+                 mode="exact", **kwargs):
+        """Initializes the per-mass dark tables.
+        Args:
+            dict_dir: directory containing the pre-computed MC samples of various shower processes
+            target_material: string label of the homogeneous material through which 
+            particles propagate
+            min_energy: minimum particle energy in GeV at which the particle 
+            finishes its propagation through the target
+            target_length: length of the target
+            mV_list: list of vector masses in GeV
+            mode: determines whether each mV is set to its value or the nearest value for which integrators have been trained
+            kwargs: further keyword arguments passed to DarkShower
+        """
+        from copy import copy
+        self._mV_list = list(mV_list)
+        if len(self._mV_list) == 0:
+            raise ValueError("mV_list must contain at least one mass")
+
+        # The SM tables (and the settings shared by all masses) are loaded once and shared by 
+        # shallow copies, only the mass-dependent dark tables are rebuilt for each mass
+        base = DarkShower(dict_dir, target_material, min_energy, target_length, self._mV_list[0], mode=mode, **kwargs)
+        sample_file=open(dict_dir + "dark_maps.pkl", 'rb')
+        dark_maps=pickle.load(sample_file)
+        sample_file.close()
+
+        self._dark_showers = {self._mV_list[0]:base}
+        for mV in self._mV_list[1:]:
+            dark_shower = copy(base)
+            dark_shower.set_mV(mV, mode)
+            dark_shower._loaded_dark_samples = {process:dark_maps[dark_shower._mV_estimator][process] for process in diff_xsection_options.keys()}
+            dark_shower.set_dark_cross_sections()
+            dark_shower.set_dark_NSigmas()
+            dark_shower.set_weight_arrays()
+            dark_shower.set_drate_dE()
+            self._dark_showers[mV] = dark_shower
+
+    def get_mV_list(self):
+        """Get the list of dark vector masses of the scan"""
+        return self._mV_list
+
+    def get_dark_shower(self, mV):
+        """Get the DarkShower holding the dark tables of mass mV (an element of the mV list)"""
+        return self._dark_showers[mV]
+
+    def generate_dark_shower(self, ExDir=None, SParams=None, return_table=False, n_oversample=1):
+        """ Process an existing SM shower (or produce a new one) and generate the possible 
+        dark photon emissions of its particles for every mass of the scan.
+        Args:
+            ExDir: path to file containing existing SM shower OR an actual shower (list of Particle objects or ParticleTable)
+            SParams: if no path provided, incident particle of a new SM shower to generate, 
+            consisting of a "Particle" object
+            return_table: bool, if True all showers are returned as ParticleTables
+            n_oversample: number of dark photons drawn per (SM particle, process), see DarkShower.generate_dark_shower
+        Returns:
+            [ShowerToSamp, NewShowers]: where ShowerToSamp is the initial SM shower and NewShowers 
+            is a dictionary {mV: list of possible dark photon emissions} 
+        """
+        base = self._dark_showers[self._mV_list[0]]
+        ShowerToSamp = base.sm_shower_to_sample(ExDir, SParams)
+        if ShowerToSamp is None:
+            return None
+
+        NewShowers = {mV:[] for mV in self._mV_list}
+        meson_decays = {mV:ParticleTable() for mV in self._mV_list}
+        if len(ShowerToSamp) > 0:
+            weights = {}
+            for mV in self._mV_list:
+                weights[mV], meson_decays[mV] = self._dark_showers[mV]._split_meson_decays(ShowerToSamp, self._dark_showers[mV].shower_BSM_weights(ShowerToSamp), n_oversample)
+            for ii, ap in enumerate(ShowerToSamp):
+                for mV in self._mV_list:
+                    if np.any(weights[mV][ii] > 0.0):
+                        NewShowers[mV].extend(self._dark_showers[mV].dark_emissions(ap, weights[mV][ii], n_oversample=n_oversample))
+        if return_table:
+            return ParticleTable.from_particles(ShowerToSamp), {mV:ParticleTable.concatenate([ParticleTable.from_particles(NewShowers[mV]), meson_decays[mV]], renumber_events=False)
+                                                                for mV in self._mV_list}
+        return ShowerToSamp, {mV:NewShowers[mV] + meson_decays[mV].to_particles() for mV in self._mV_list}
+
+    def generate_dark_showers(self, showers=None, incident_particles=None, return_table=False, n_oversample=1):
+        """ Process a batch of SM showers (existing ones or new ones from a list of incident 
+        particles), each SM shower is produced once and reused for all masses.
+        Args:
+            showers: list of existing SM showers (each a file path, list of Particle objects or ParticleTable)
+            incident_particles: if no showers provided, list of incident "Particle" objects of the new SM showers to generate
+            return_table: bool, if True the dark photons of each mass are returned as a ParticleTable, 
+            with the position of the SM shower in the batch as event_index
+            n_oversample: number of dark photons drawn per (SM particle, process), see DarkShower.generate_dark_shower
+        Returns:
+            [SMShowers, NewShowers]: where SMShowers is the list of SM showers and NewShowers 
+            is a dictionary {mV: list of possible dark photon emissions from all showers}
+        """
+        if showers is not None:
+            results = [self.generate_dark_shower(ExDir=shower, n_oversample=n_oversample) for shower in showers]
+        elif incident_particles is not None:
+            results = [self.generate_dark_shower(SParams=particle, n_oversample=n_oversample) for particle in incident_particles]
+        else:
+            print("Need a list of existing SM showers or SM incident particles to run dark showers")
+            return None
+
+        SMShowers = [result[0] for result in results]
+        if return_table:
+            return SMShowers, {mV:ParticleTable.from_showers([result[1][mV] for result in results]) for mV in self._mV_list}
+        NewShowers = {mV:[npart for result in results for npart in result[1][mV]] for mV in self._mV_list}
+        return SMShowers, NewShowers
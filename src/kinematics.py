@@ -1,10 +1,10 @@
 import numpy as np
 try:
     from .physical_constants import *
-    from .radiative_return import boost, invariant_mass
+    from .radiative_return import boost, boost_batch, invariant_mass
 except:
     from physical_constants import *
-    from radiative_return import boost, invariant_mass
+    from radiative_return import boost, boost_batch, invariant_mass
 
 Egamma_min = 0.001
 def e_to_egamma_fourvecs(p0, sampled_event):
@@ -223,3 +223,225 @@ def annihilation_fourvecs(p0, sampled_event, mV=0.0):
 
     return [pg4v, pV4v]
 
+
+#-------------------------------------------------------------------
+#Array versions of the functions above, for N incoming particles at once.
+#Incoming particles are taken to move along the z-axis (as above), energies
+#are an (N,) array and sampled_events an (N,d) array of MC samples.
+#All return an (N,2,4) array of the two outgoing four-vectors, in the same
+#order as the single-particle versions.
+#-------------------------------------------------------------------
+def _azimuths(n, rng=None):
+    """Draws n azimuthal angles uniformly in [0, 2pi) from rng (default: numpy's global random state)"""
+    rng = np.random if rng is None else rng
+    return rng.uniform(0, 2.0*np.pi, size=n)
+
+def _sampled_columns(sampled_events, n_columns):
+    """Returns the first n_columns columns of an (N,d) array of sampled events"""
+    sampled_events = np.asarray(sampled_events, dtype=float)
+    if sampled_events.ndim == 1:
+        sampled_events = sampled_events[:,np.newaxis]
+    return [sampled_events[:,ii] for ii in range(n_columns)]
+
+def e_to_egamma_fourvecs_batch(energies, sampled_events, rng=None):
+    """Array version of e_to_egamma_fourvecs
+    Args:
+        energies: (N,) array of incoming electron/positron energies
+        sampled_events: (N,4) array of MC samples of outgoing kinematics
+        rng: optional numpy random Generator (default: numpy's global random state)
+    Returns:
+        (N,2,4) array of final electron and photon four-momenta in that order
+    """
+    ep = np.asarray(energies, dtype=float)
+    x1, x2, x3, x4 = _sampled_columns(sampled_events, 4)
+    w = Egamma_min + x1*(ep - m_electron - Egamma_min)
+    ct = np.cos((x2+x3)/2)
+    ctp = np.cos((x2-x3)*ep/(2*(ep-w)))
+    ph = (x4-1/2)*2.0*np.pi
+
+    epp = ep - w
+    pp = np.sqrt(epp**2 - m_electron**2)
+
+    al = _azimuths(len(ep), rng)
+    cal, sal = np.cos(al), np.sin(al)
+    st, stp = np.sqrt(1.0 - ct**2), np.sqrt(1.0 - ctp**2)
+    sp, cp = np.sin(ph), np.cos(ph)
+    g4v = np.stack([w, w*cal*st, w*sal*st, w*ct], axis=-1)
+
+    Ep4v = np.stack([epp, pp*(sal*sp*stp + cal*(ctp*st - cp*ct*stp)), pp*(ctp*sal*st - (cp*ct*sal + cal*sp)*stp), pp*(ct*ctp + cp*st*stp)], axis=-1)
+
+    return np.stack([Ep4v, g4v], axis=1)
+
+def e_to_eV_fourvecs_batch(energies, sampled_events, mV=0.0, rng=None):
+    """Array version of e_to_eV_fourvecs
+    Args:
+        energies: (N,) array of incoming electron/positron energies
+        sampled_events: (N,2) array of MC samples of outgoing kinematics
+        optional mV: dark vector mass
+        rng: optional numpy random Generator (default: numpy's global random state)
+    Returns:
+        (N,2,4) array of the (incoming) electron and dark vector four-momenta in that order
+    """
+    ep = np.asarray(energies, dtype=float)
+    x1, x2 = _sampled_columns(sampled_events, 2)
+    w = x1*ep
+    ct = (1 - 10**x2)
+    p, k = np.sqrt(ep**2 - m_electron**2), np.sqrt(w**2 - mV**2)
+
+    Em4v = np.stack([ep, np.zeros_like(ep), np.zeros_like(ep), p], axis=-1)
+    al = _azimuths(len(ep), rng)
+    cal, sal = np.cos(al), np.sin(al)
+    st = np.sqrt(1.0 - ct**2)
+    V4v = np.stack([w, k*cal*st, k*sal*st, k*ct], axis=-1)
+
+    return np.stack([Em4v, V4v], axis=1)
+
+def gamma_to_epem_fourvecs_batch(energies, sampled_events, rng=None):
+    """Array version of gamma_to_epem_fourvecs
+    Args:
+        energies: (N,) array of incoming photon energies
+        sampled_events: (N,4) array of MC samples of outgoing kinematics
+        rng: optional numpy random Generator (default: numpy's global random state)
+    Returns:
+        (N,2,4) array of the outgoing positron and electron four-momenta in that order
+    """
+    w = np.asarray(energies, dtype=float)
+    x1, x2, x3, x4 = _sampled_columns(sampled_events, 4)
+    epp = m_electron + x1*(w-2*m_electron)
+    ctp = np.cos(w*(x2+x3)/(2*epp))
+    ctm = np.cos(w*(x2-x3)/(2*(w-epp)))
+    ph = x4*2*np.pi
+
+    epm = w - epp
+    pm, pp = np.sqrt(epm**2 - m_electron**2), np.sqrt(epp**2 - m_electron**2)
+
+    al = _azimuths(len(w), rng)
+    cal, sal = np.cos(al), np.sin(al)
+    stp, stm = np.sqrt(1.0 - ctp**2), np.sqrt(1.0 - ctm**2)
+    spal, cpal = np.sin(ph+al), np.cos(ph+al)
+
+    pp4v = np.stack([epp, pp*stp*cal, pp*stp*sal, pp*ctp], axis=-1)
+    pm4v = np.stack([epm, pm*stm*cpal, pm*stm*spal, pm*ctm], axis=-1)
+
+    return np.stack([pp4v, pm4v], axis=1)
+
+def _two_body_fourvecs_batch(E1, E2, pF, ct, boost_energy, rng=None):
+    """Shared part of the Compton and Moller/Bhabha array versions:
+    builds the CM-frame final state with momentum pF along cos(theta) = ct for particle 1
+    and boosts it along z into the frame where the target electron is at rest
+    """
+    g0 = boost_energy/m_electron
+    b0 = 1.0/g0*np.sqrt(g0**2 - 1.0)
+
+    ph = _azimuths(len(ct), rng)
+    pT = pF*np.sqrt(1-ct**2)
+    sph, cph = np.sin(ph), np.cos(ph)
+    p14v = np.stack([g0*E1 + b0*g0*pF*ct, -pT*sph, -pT*cph, b0*g0*E1 + g0*pF*ct], axis=-1)
+    p24v = np.stack([g0*E2 - b0*g0*pF*ct, pT*sph, pT*cph, b0*g0*E2 - g0*pF*ct], axis=-1)
+    return np.stack([p14v, p24v], axis=1)
+
+def compton_fourvecs_batch(energies, sampled_events, mV=0.0, rng=None):
+    """Array version of compton_fourvecs
+    Args:
+        energies: (N,) array of incoming photon energies
+        sampled_events: (N,d) array with cos(theta) of the outgoing electron as zero'th column
+        optional mV: mass of outgoing dark vector
+        rng: optional numpy random Generator (default: numpy's global random state)
+    Returns:
+        (N,2,4) array of the final state electron and vector (SM or dark photon) four-momenta
+    """
+    Eg = np.asarray(energies, dtype=float)
+    ct, = _sampled_columns(sampled_events, 1)
+
+    s = m_electron**2 + 2*Eg*m_electron
+    Ee0 = (s + m_electron**2)/(2.0*np.sqrt(s))
+    Ee = (s - mV**2 + m_electron**2)/(2*np.sqrt(s))
+    EV = (s + mV**2 - m_electron**2)/(2*np.sqrt(s))
+    pF = np.sqrt(Ee**2 - m_electron**2)
+
+    return _two_body_fourvecs_batch(Ee, EV, pF, ct, Ee0, rng=rng)
+
+def ee_to_ee_fourvecs_batch(energies, sampled_events, rng=None):
+    """Array version of ee_to_ee_fourvecs
+    Args:
+        energies: (N,) array of incoming electron/positron energies
+        sampled_events: (N,d) array with cos(theta) of the outgoing particle as zero'th column
+        rng: optional numpy random Generator (default: numpy's global random state)
+    Returns:
+        (N,2,4) array of the final state electron and positron/electron four-momenta
+    """
+    Einc = np.asarray(energies, dtype=float)
+    ct, = _sampled_columns(sampled_events, 1)
+
+    s = 2*m_electron**2 + 2*Einc*m_electron
+    Ee0 = np.sqrt(s)/2.0
+    pF = np.sqrt(Ee0**2 - m_electron**2)
+
+    return _two_body_fourvecs_batch(Ee0, Ee0, pF, ct, Ee0, rng=rng)
+
+def annihilation_fourvecs_batch(energies, sampled_events, mV=0.0, rng=None):
+    """Array version of annihilation_fourvecs
+    Args:
+        energies: (N,) array of incoming positron energies
+        sampled_events: (N,d) array with cos(theta) of the outgoing vector as zero'th column
+        optional mV: mass of dark vector being produced
+        rng: optional numpy random Generator (default: numpy's global random state)
+    Returns:
+        (N,2,4) array of the two final state vectors: two SM photons, or one SM photon
+        and one dark photon
+    """
+    Ee = np.asarray(energies, dtype=float)
+    ct, = _sampled_columns(sampled_events, 1)
+    if np.any((ct < -1.0) | (ct > 1.0)):
+        print("Error in Annihiliation Calculation")
+        print(Ee[(ct < -1.0) | (ct > 1.0)], m_electron, mV, ct[(ct < -1.0) | (ct > 1.0)])
+
+    s = 2*m_electron*(Ee+m_electron)
+    EeCM = np.sqrt(s)/2.0
+    Eg = (s - mV**2)/(2*np.sqrt(s))
+    EV = (s + mV**2)/(2*np.sqrt(s))
+    pF = Eg
+
+    g0 = EeCM/m_electron
+    b0 = 1.0/g0*np.sqrt(g0**2-1.0)
+
+    ph = _azimuths(len(Ee), rng)
+    pT = pF*np.sqrt(1-ct**2)
+    sph, cph = np.sin(ph), np.cos(ph)
+    pg4v = np.stack([g0*Eg - b0*g0*pF*ct, -pT*sph, -pT*cph, b0*g0*Eg - g0*pF*ct], axis=-1)
+    pV4v = np.stack([g0*EV + b0*g0*pF*ct, pT*sph, pT*cph, b0*g0*EV + g0*pF*ct], axis=-1)
+
+    return np.stack([pg4v, pV4v], axis=1)
+
+def radiative_return_fourvecs_batch(energies, sampled_events, mV=0.0, rng=None):
+    """Array version of radiative_return_fourvecs (collinear ISR, so no random angles are drawn;
+    rng is accepted for a uniform interface)
+    Args:
+        energies: (N,) array of incoming positron energies
+        sampled_events: (N,d) array whose zero'th column is the sampled variable u, with
+            the positron energy fraction after radiation x1 = 1 - u^(2/beta)
+        optional mV: vector mass
+    Returns:
+        (N,2,4) array with the dark vector four-momentum repeated twice (as in the single-particle version)
+    """
+    Ee = np.asarray(energies, dtype=float)
+    u, = _sampled_columns(sampled_events, 1)
+    s = 2.*m_electron*(m_electron + Ee)
+
+    beta = (2.*alpha_em/np.pi) * (np.log(s/m_electron**2) - 1.)
+
+    x1 = 1.- np.power(u,2./beta)
+    x2 = mV**2/(x1*s)
+    if np.any(x2 > 1.):
+        print("wrong kinematics...")
+        print("x1, x2 = ", x1[x2 > 1.], "\t", x2[x2 > 1.], "\t mV^2 = ", mV**2)
+
+    E1 = x1*np.sqrt(s)/2.
+    E2 = x2*np.sqrt(s)/2.
+
+    #CM four-momentum of the vector after the beam particles have radiated
+    pV = np.stack([E1 + E2, np.zeros_like(E1), np.zeros_like(E1), E1 - E2], axis=-1)
+    #boost to the frame where the electron (before radiation) is at rest
+    p_rest = np.stack([np.sqrt(s)/2., np.zeros_like(s), np.zeros_like(s), -np.sqrt(s/4. - m_electron**2)], axis=-1)
+    pV_lab = boost_batch(p_rest, pV)
+    return np.stack([pV_lab, pV_lab], axis=1)
@@ -1,9904 +0,0 @@
-import numpy as np
-lumi_integral_list = np.array(
-    [[1.000000000000000021e-03, 1.000000000000000021e-03, 1.786393670644991979e-02], 
-[1.000000000000000021e-03, 1.148922311909569708e-03, 1.785615470155757847e-02], 
-[1.000000000000000021e-03, 1.320022478803632065e-03, 1.784875504563716853e-02], 
-[1.000000000000000021e-03, 1.516603278119670137e-03, 1.784179504075078179e-02], 
-[1.000000000000000021e-03, 1.742459344546885402e-03, 1.783534068023093916e-02], 
-[1.000000000000000021e-03, 2.001950418545241171e-03, 1.782946799980563574e-02], 
-[1.000000000000000021e-03, 2.300085503203331758e-03, 1.782426464914840109e-02], 
-[1.000000000000000021e-03, 2.642619553930058204e-03, 1.781983172295215773e-02], 
-[1.000000000000000021e-03, 3.036164567398761706e-03, 1.781628589881466967e-02], 
-[1.000000000000000021e-03, 3.488317214113704091e-03, 1.781376193852012013e-02], 
-[1.000000000000000021e-03, 4.007805478313466660e-03, 1.781241562206135887e-02], 
-[1.000000000000000021e-03, 4.604657135827751671e-03, 1.781242719857651507e-02], 
-[1.000000000000000021e-03, 5.290393322046124149e-03, 1.781400545772702723e-02], 
-[1.000000000000000021e-03, 6.078250926476181683e-03, 1.781739254930584521e-02], 
-[1.000000000000000021e-03, 6.983438106813499684e-03, 1.782286970977008111e-02], 
-[1.000000000000000021e-03, 8.023427854757562983e-03, 1.783076409421548159e-02], 
-[1.000000000000000021e-03, 9.218295280327699903e-03, 1.784145696323544833e-02], 
-[1.000000000000000021e-03, 1.059110512533918171e-02, 1.785539354088850478e-02], 
-[1.000000000000000021e-03, 1.216835698628199354e-02, 1.787309494666912760e-02], 
-[1.000000000000000021e-03, 1.398049684082008047e-02, 1.789517271878202781e-02], 
-[1.000000000000000021e-03, 1.606250475199945058e-02, 1.792234659746384795e-02], 
-[1.000000000000000021e-03, 1.845457009472566828e-02, 1.795546643920351709e-02], 
-[1.000000000000000021e-03, 2.120286733852943389e-02, 1.799553940443600689e-02], 
-[1.000000000000000021e-03, 2.436044736169515681e-02, 1.804376392951230826e-02], 
-[1.000000000000000021e-03, 2.798826150195019707e-02, 1.810157249696398019e-02], 
-[1.000000000000000021e-03, 3.215633811115024138e-02, 1.817068591209368769e-02], 
-[1.000000000000000021e-03, 3.694513432520856594e-02, 1.825318276026459408e-02], 
-[1.000000000000000021e-03, 4.244708914272822542e-02, 1.835158907948104129e-02], 
-[1.000000000000000021e-03, 4.876840779169493850e-02, 1.846899521936105210e-02], 
-[1.000000000000000021e-03, 5.603111182818285713e-02, 1.860920965005938288e-02], 
-[1.000000000000000021e-03, 6.437539454049952259e-02, 1.877696356783785381e-02], 
-[1.000000000000000021e-03, 7.396232712556144451e-02, 1.897818620704577047e-02], 
-[1.000000000000000021e-03, 8.497696787531199003e-02, 1.922037992616228153e-02], 
-[1.000000000000000021e-03, 9.763193439036874088e-02, 1.951313823248249785e-02], 
-[1.000000000000000021e-03, 1.121715077759858903e-01, 1.986887207274582595e-02], 
-[1.000000000000000021e-03, 1.288763480443681220e-01, 2.030384539341134262e-02], 
-[1.000000000000000021e-03, 1.480689117455977755e-01, 2.083967994966480497e-02], 
-[1.000000000000000021e-03, 1.701196764046864207e-01, 2.150558980174722273e-02], 
-[1.000000000000000021e-03, 1.954542919161802172e-01, 2.234178300168477432e-02], 
-[1.000000000000000021e-03, 2.245617969409859638e-01, 2.340479250729988678e-02], 
-[1.000000000000000021e-03, 2.580040589080049296e-01, 2.477612072770256357e-02], 
-[1.000000000000000021e-03, 2.964266198426381838e-01, 2.657684059012650757e-02], 
-[1.000000000000000021e-03, 3.405711573811430193e-01, 2.899350608869655926e-02], 
-[1.000000000000000021e-03, 3.912898015080607528e-01, 3.232702259169801390e-02], 
-[1.000000000000000021e-03, 4.495615833752782953e-01, 3.709220411352620594e-02], 
-[1.000000000000000021e-03, 5.165113337172515529e-01, 4.424202209594914337e-02], 
-[1.000000000000000021e-03, 5.934313956619206021e-01, 5.574681791097897687e-02], 
-[1.000000000000000021e-03, 6.818065710636164178e-01, 7.642054758395444569e-02], 
-[1.000000000000000021e-03, 7.833427819015473803e-01, 1.218995426622482975e-01], 
-[1.000000000000000021e-03, 9.000000000000000222e-01, 2.885343064776936250e-01], 
-[1.000000000000000021e-03, 9.020408163265306589e-01, 2.949415645246922790e-01], 
-[1.000000000000000021e-03, 9.040816326530612956e-01, 3.016179511414233128e-01], 
-[1.000000000000000021e-03, 9.061224489795918213e-01, 3.085808092402066993e-01], 
-[1.000000000000000021e-03, 9.081632653061224580e-01, 3.158490095486372051e-01], 
-[1.000000000000000021e-03, 9.102040816326530948e-01, 3.234431229751884018e-01], 
-[1.000000000000000021e-03, 9.122448979591837315e-01, 3.313856168802512547e-01], 
-[1.000000000000000021e-03, 9.142857142857142572e-01, 3.397010792159655956e-01], 
-[1.000000000000000021e-03, 9.163265306122448939e-01, 3.484164752679336230e-01], 
-[1.000000000000000021e-03, 9.183673469387755306e-01, 3.575614426741680063e-01], 
-[1.000000000000000021e-03, 9.204081632653061673e-01, 3.671686315553380764e-01], 
-[1.000000000000000021e-03, 9.224489795918368040e-01, 3.772740980224311702e-01], 
-[1.000000000000000021e-03, 9.244897959183673297e-01, 3.879177611068710396e-01], 
-[1.000000000000000021e-03, 9.265306122448979664e-01, 3.991439353798859058e-01], 
-[1.000000000000000021e-03, 9.285714285714286031e-01, 4.110019543185629010e-01], 
-[1.000000000000000021e-03, 9.306122448979592399e-01, 4.235469030023315540e-01], 
-[1.000000000000000021e-03, 9.326530612244897656e-01, 4.368404832074010979e-01], 
-[1.000000000000000021e-03, 9.346938775510204023e-01, 4.509520397062678487e-01], 
-[1.000000000000000021e-03, 9.367346938775510390e-01, 4.659597839781762785e-01], 
-[1.000000000000000021e-03, 9.387755102040816757e-01, 4.819522611452659588e-01], 
-[1.000000000000000021e-03, 9.408163265306123124e-01, 4.990301185271718287e-01], 
-[1.000000000000000021e-03, 9.428571428571428381e-01, 5.173082508103613586e-01], 
-[1.000000000000000021e-03, 9.448979591836734748e-01, 5.369184189424105469e-01], 
-[1.000000000000000021e-03, 9.469387755102041115e-01, 5.580124695967207948e-01], 
-[1.000000000000000021e-03, 9.489795918367347483e-01, 5.807663224461421247e-01], 
-[1.000000000000000021e-03, 9.510204081632652739e-01, 6.053849479574020531e-01], 
-[1.000000000000000021e-03, 9.530612244897959107e-01, 6.321086355022743630e-01], 
-[1.000000000000000021e-03, 9.551020408163265474e-01, 6.612209600586224090e-01], 
-[1.000000000000000021e-03, 9.571428571428571841e-01, 6.930590105327500972e-01], 
-[1.000000000000000021e-03, 9.591836734693878208e-01, 7.280266668177179934e-01], 
-[1.000000000000000021e-03, 9.612244897959183465e-01, 7.666120424446923876e-01], 
-[1.000000000000000021e-03, 9.632653061224489832e-01, 8.094107035363555802e-01], 
-[1.000000000000000021e-03, 9.653061224489796199e-01, 8.571570288549910099e-01], 
-[1.000000000000000021e-03, 9.673469387755102566e-01, 9.107672519924902010e-01], 
-[1.000000000000000021e-03, 9.693877551020407823e-01, 9.713996053866920111e-01], 
-[1.000000000000000021e-03, 9.714285714285714191e-01, 1.040540066332706903e+00], 
-[1.000000000000000021e-03, 9.734693877551020558e-01, 1.120127407796496666e+00], 
-[1.000000000000000021e-03, 9.755102040816326925e-01, 1.212740341921368037e+00], 
-[1.000000000000000021e-03, 9.775510204081632182e-01, 1.321886024477080035e+00], 
-[1.000000000000000021e-03, 9.795918367346938549e-01, 1.452460423607308648e+00], 
-[1.000000000000000021e-03, 9.816326530612244916e-01, 1.611513358517175698e+00], 
-[1.000000000000000021e-03, 9.836734693877551283e-01, 1.809583016724873872e+00], 
-[1.000000000000000021e-03, 9.857142857142857650e-01, 2.063165498567460787e+00], 
-[1.000000000000000021e-03, 9.877551020408162907e-01, 2.399634048587529822e+00], 
-[1.000000000000000021e-03, 9.897959183673469274e-01, 2.868011424541749399e+00], 
-[1.000000000000000021e-03, 9.918367346938775642e-01, 3.565754378789004697e+00], 
-[1.000000000000000021e-03, 9.938775510204082009e-01, 4.718570895491019712e+00], 
-[1.000000000000000021e-03, 9.959183673469387266e-01, 6.996878840415673650e+00], 
-[1.000000000000000021e-03, 9.979591836734693633e-01, 1.370051278529932048e+01], 
-[1.000000000000000021e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.097498765493055582e-03, 1.000000000000000021e-03, 1.810646863009243712e-02], 
-[1.097498765493055582e-03, 1.148922311909569708e-03, 1.809844612723211787e-02], 
-[1.097498765493055582e-03, 1.320022478803632065e-03, 1.809081094045734625e-02], 
-[1.097498765493055582e-03, 1.516603278119670137e-03, 1.808362111321898391e-02], 
-[1.097498765493055582e-03, 1.742459344546885402e-03, 1.807694349224715086e-02], 
-[1.097498765493055582e-03, 2.001950418545241171e-03, 1.807085509602717258e-02], 
-[1.097498765493055582e-03, 2.300085503203331758e-03, 1.806544470652113668e-02], 
-[1.097498765493055582e-03, 2.642619553930058204e-03, 1.806081472374215791e-02], 
-[1.097498765493055582e-03, 3.036164567398761706e-03, 1.805708333104964064e-02], 
-[1.097498765493055582e-03, 3.488317214113704091e-03, 1.805438702850908211e-02], 
-[1.097498765493055582e-03, 4.007805478313466660e-03, 1.805288360451390642e-02], 
-[1.097498765493055582e-03, 4.604657135827751671e-03, 1.805275563093380192e-02], 
-[1.097498765493055582e-03, 5.290393322046124149e-03, 1.805421458663396955e-02], 
-[1.097498765493055582e-03, 6.078250926476181683e-03, 1.805750573878347337e-02], 
-[1.097498765493055582e-03, 6.983438106813499684e-03, 1.806291394267543066e-02], 
-[1.097498765493055582e-03, 8.023427854757562983e-03, 1.807077056109348406e-02], 
-[1.097498765493055582e-03, 9.218295280327699903e-03, 1.808146175586492627e-02], 
-[1.097498765493055582e-03, 1.059110512533918171e-02, 1.809543847183313001e-02], 
-[1.097498765493055582e-03, 1.216835698628199354e-02, 1.811322852127876179e-02], 
-[1.097498765493055582e-03, 1.398049684082008047e-02, 1.813545129266538186e-02], 
-[1.097498765493055582e-03, 1.606250475199945058e-02, 1.816283576094894145e-02], 
-[1.097498765493055582e-03, 1.845457009472566828e-02, 1.819624268135597994e-02], 
-[1.097498765493055582e-03, 2.120286733852943389e-02, 1.823669212369377624e-02], 
-[1.097498765493055582e-03, 2.436044736169515681e-02, 1.828539787713229225e-02], 
-[1.097498765493055582e-03, 2.798826150195019707e-02, 1.834381076496050672e-02], 
-[1.097498765493055582e-03, 3.215633811115024138e-02, 1.841367361156676097e-02], 
-[1.097498765493055582e-03, 3.694513432520856594e-02, 1.849709158239437601e-02], 
-[1.097498765493055582e-03, 4.244708914272822542e-02, 1.859662299491202098e-02], 
-[1.097498765493055582e-03, 4.876840779169493850e-02, 1.871539765942854469e-02], 
-[1.097498765493055582e-03, 5.603111182818285713e-02, 1.885727263598655640e-02], 
-[1.097498765493055582e-03, 6.437539454049952259e-02, 1.902703942772159679e-02], 
-[1.097498765493055582e-03, 7.396232712556144451e-02, 1.923070276975576143e-02], 
-[1.097498765493055582e-03, 8.497696787531199003e-02, 1.947586044458252119e-02], 
-[1.097498765493055582e-03, 9.763193439036874088e-02, 1.977222782696788639e-02], 
-[1.097498765493055582e-03, 1.121715077759858903e-01, 2.013237329889102506e-02], 
-[1.097498765493055582e-03, 1.288763480443681220e-01, 2.057276679283412749e-02], 
-[1.097498765493055582e-03, 1.480689117455977755e-01, 2.111530342509226887e-02], 
-[1.097498765493055582e-03, 1.701196764046864207e-01, 2.178956587738154621e-02], 
-[1.097498765493055582e-03, 1.954542919161802172e-01, 2.263626842446919002e-02], 
-[1.097498765493055582e-03, 2.245617969409859638e-01, 2.371265401503157288e-02], 
-[1.097498765493055582e-03, 2.580040589080049296e-01, 2.510124578266355322e-02], 
-[1.097498765493055582e-03, 2.964266198426381838e-01, 2.692462817472700276e-02], 
-[1.097498765493055582e-03, 3.405711573811430193e-01, 2.937167584768239290e-02], 
-[1.097498765493055582e-03, 3.912898015080607528e-01, 3.274702193500603903e-02], 
-[1.097498765493055582e-03, 4.495615833752782953e-01, 3.757182780013874901e-02], 
-[1.097498765493055582e-03, 5.165113337172515529e-01, 4.481074827494418988e-02], 
-[1.097498765493055582e-03, 5.934313956619206021e-01, 5.645811609450622492e-02], 
-[1.097498765493055582e-03, 6.818065710636164178e-01, 7.738599639655634188e-02], 
-[1.097498765493055582e-03, 7.833427819015473803e-01, 1.234172197460744885e-01], 
-[1.097498765493055582e-03, 9.000000000000000222e-01, 2.920279422944939696e-01], 
-[1.097498765493055582e-03, 9.020408163265306589e-01, 2.985101575262382179e-01], 
-[1.097498765493055582e-03, 9.040816326530612956e-01, 3.052645866648145967e-01], 
-[1.097498765493055582e-03, 9.061224489795918213e-01, 3.123087687316112859e-01], 
-[1.097498765493055582e-03, 9.081632653061224580e-01, 3.196617876606139275e-01], 
-[1.097498765493055582e-03, 9.102040816326530948e-01, 3.273444465766859324e-01], 
-[1.097498765493055582e-03, 9.122448979591837315e-01, 3.353794662426619055e-01], 
-[1.097498765493055582e-03, 9.142857142857142572e-01, 3.437917116820113916e-01], 
-[1.097498765493055582e-03, 9.163265306122448939e-01, 3.526084517619392233e-01], 
-[1.097498765493055582e-03, 9.183673469387755306e-01, 3.618596574743005445e-01], 
-[1.097498765493055582e-03, 9.204081632653061673e-01, 3.715783458230196845e-01], 
-[1.097498765493055582e-03, 9.224489795918368040e-01, 3.818009776742974926e-01], 
-[1.097498765493055582e-03, 9.244897959183673297e-01, 3.925679197241196960e-01], 
-[1.097498765493055582e-03, 9.265306122448979664e-01, 4.039239829834040396e-01], 
-[1.097498765493055582e-03, 9.285714285714286031e-01, 4.159190530019760690e-01], 
-[1.097498765493055582e-03, 9.306122448979592399e-01, 4.286088306170067197e-01], 
-[1.097498765493055582e-03, 9.326530612244897656e-01, 4.420557065437568101e-01], 
-[1.097498765493055582e-03, 9.346938775510204023e-01, 4.563297989280017397e-01], 
-[1.097498765493055582e-03, 9.367346938775510390e-01, 4.715101904580068504e-01], 
-[1.097498765493055582e-03, 9.387755102040816757e-01, 4.876864113462228145e-01], 
-[1.097498765493055582e-03, 9.408163265306123124e-01, 5.049602272041211481e-01], 
-[1.097498765493055582e-03, 9.428571428571428381e-01, 5.234478076154039927e-01], 
-[1.097498765493055582e-03, 9.448979591836734748e-01, 5.432823735638718787e-01], 
-[1.097498765493055582e-03, 9.469387755102041115e-01, 5.646174519259765656e-01], 
-[1.097498765493055582e-03, 9.489795918367347483e-01, 5.876309060630022785e-01], 
-[1.097498765493055582e-03, 9.510204081632652739e-01, 6.125299676136224392e-01], 
-[1.097498765493055582e-03, 9.530612244897959107e-01, 6.395575724934841055e-01], 
-[1.097498765493055582e-03, 9.551020408163265474e-01, 6.690004137404419460e-01], 
-[1.097498765493055582e-03, 9.571428571428571841e-01, 7.011992802470822239e-01], 
-[1.097498765493055582e-03, 9.591836734693878208e-01, 7.365624768827985225e-01], 
-[1.097498765493055582e-03, 9.612244897959183465e-01, 7.755834547421714964e-01], 
-[1.097498765493055582e-03, 9.632653061224489832e-01, 8.188642793285410004e-01], 
-[1.097498765493055582e-03, 9.653061224489796199e-01, 8.671473265203836212e-01], 
-[1.097498765493055582e-03, 9.673469387755102566e-01, 9.213587848055719842e-01], 
-[1.097498765493055582e-03, 9.693877551020407823e-01, 9.826694406391642822e-01], 
-[1.097498765493055582e-03, 9.714285714285714191e-01, 1.052581336546587920e+00], 
-[1.097498765493055582e-03, 9.734693877551020558e-01, 1.133054148617952839e+00], 
-[1.097498765493055582e-03, 9.755102040816326925e-01, 1.226694309839599928e+00], 
-[1.097498765493055582e-03, 9.775510204081632182e-01, 1.337046557393045898e+00], 
-[1.097498765493055582e-03, 9.795918367346938549e-01, 1.469059140864116486e+00], 
-[1.097498765493055582e-03, 9.816326530612244916e-01, 1.629856874089782526e+00], 
-[1.097498765493055582e-03, 9.836734693877551283e-01, 1.830089574725771051e+00], 
-[1.097498765493055582e-03, 9.857142857142857650e-01, 2.086427257746339414e+00], 
-[1.097498765493055582e-03, 9.877551020408162907e-01, 2.426530201670172637e+00], 
-[1.097498765493055582e-03, 9.897959183673469274e-01, 2.899931992321085339e+00], 
-[1.097498765493055582e-03, 9.918367346938775642e-01, 3.605097293903350320e+00], 
-[1.097498765493055582e-03, 9.938775510204082009e-01, 4.770046560000531954e+00], 
-[1.097498765493055582e-03, 9.959183673469387266e-01, 7.071979911453339263e+00], 
-[1.097498765493055582e-03, 9.979591836734693633e-01, 1.384344347808151632e+01], 
-[1.097498765493055582e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.204503540258782370e-03, 1.000000000000000021e-03, 1.834934431904003405e-02], 
-[1.204503540258782370e-03, 1.148922311909569708e-03, 1.834107757861466043e-02], 
-[1.204503540258782370e-03, 1.320022478803632065e-03, 1.833320312270957791e-02], 
-[1.204503540258782370e-03, 1.516603278119670137e-03, 1.832577973628704560e-02], 
-[1.204503540258782370e-03, 1.742459344546885402e-03, 1.831887511960518522e-02], 
-[1.204503540258782370e-03, 2.001950418545241171e-03, 1.831256727404429255e-02], 
-[1.204503540258782370e-03, 2.300085503203331758e-03, 1.830694611399951918e-02], 
-[1.204503540258782370e-03, 2.642619553930058204e-03, 1.830211534495390646e-02], 
-[1.204503540258782370e-03, 3.036164567398761706e-03, 1.829819465618313934e-02], 
-[1.204503540258782370e-03, 3.488317214113704091e-03, 1.829532228619078910e-02], 
-[1.204503540258782370e-03, 4.007805478313466660e-03, 1.829365803192732620e-02], 
-[1.204503540258782370e-03, 4.604657135827751671e-03, 1.829338678814680305e-02], 
-[1.204503540258782370e-03, 5.290393322046124149e-03, 1.829472272306260916e-02], 
-[1.204503540258782370e-03, 6.078250926476181683e-03, 1.829791422135010684e-02], 
-[1.204503540258782370e-03, 6.983438106813499684e-03, 1.830324975724616915e-02], 
-[1.204503540258782370e-03, 8.023427854757562983e-03, 1.831106490129811096e-02], 
-[1.204503540258782370e-03, 9.218295280327699903e-03, 1.832175071659731397e-02], 
-[1.204503540258782370e-03, 1.059110512533918171e-02, 1.833576386873955397e-02], 
-[1.204503540258782370e-03, 1.216835698628199354e-02, 1.835363886267429162e-02], 
-[1.204503540258782370e-03, 1.398049684082008047e-02, 1.837600293689215999e-02], 
-[1.204503540258782370e-03, 1.606250475199945058e-02, 1.840359430068330346e-02], 
-[1.204503540258782370e-03, 1.845457009472566828e-02, 1.843728460742172226e-02], 
-[1.204503540258782370e-03, 2.120286733852943389e-02, 1.847810683542479987e-02], 
-[1.204503540258782370e-03, 2.436044736169515681e-02, 1.852729012543976109e-02], 
-[1.204503540258782370e-03, 2.798826150195019707e-02, 1.858630363978921660e-02], 
-[1.204503540258782370e-03, 3.215633811115024138e-02, 1.865691221953697659e-02], 
-[1.204503540258782370e-03, 3.694513432520856594e-02, 1.874124760687492786e-02], 
-[1.204503540258782370e-03, 4.244708914272822542e-02, 1.884190039413118772e-02], 
-[1.204503540258782370e-03, 4.876840779169493850e-02, 1.896203984593052005e-02], 
-[1.204503540258782370e-03, 5.603111182818285713e-02, 1.910557160334499030e-02], 
-[1.204503540258782370e-03, 6.437539454049952259e-02, 1.927734746400586868e-02], 
-[1.204503540258782370e-03, 7.396232712556144451e-02, 1.948344764638910293e-02], 
-[1.204503540258782370e-03, 8.497696787531199003e-02, 1.973156533228172943e-02], 
-[1.204503540258782370e-03, 9.763193439036874088e-02, 2.003153772849412470e-02], 
-[1.204503540258782370e-03, 1.121715077759858903e-01, 2.039609060091385206e-02], 
-[1.204503540258782370e-03, 1.288763480443681220e-01, 2.084189979274039817e-02], 
-[1.204503540258782370e-03, 1.480689117455977755e-01, 2.139113366934229654e-02], 
-[1.204503540258782370e-03, 1.701196764046864207e-01, 2.207374336455481673e-02], 
-[1.204503540258782370e-03, 1.954542919161802172e-01, 2.293094911515459675e-02], 
-[1.204503540258782370e-03, 2.245617969409859638e-01, 2.402070345060159859e-02], 
-[1.204503540258782370e-03, 2.580040589080049296e-01, 2.542654956749870049e-02], 
-[1.204503540258782370e-03, 2.964266198426381838e-01, 2.727258233320554309e-02], 
-[1.204503540258782370e-03, 3.405711573811430193e-01, 2.974999516659478788e-02], 
-[1.204503540258782370e-03, 3.912898015080607528e-01, 3.316714552535004329e-02], 
-[1.204503540258782370e-03, 4.495615833752782953e-01, 3.805153549289333470e-02], 
-[1.204503540258782370e-03, 5.165113337172515529e-01, 4.537948941308202200e-02], 
-[1.204503540258782370e-03, 5.934313956619206021e-01, 5.716929870696553506e-02], 
-[1.204503540258782370e-03, 6.818065710636164178e-01, 7.835104564021537488e-02], 
-[1.204503540258782370e-03, 7.833427819015473803e-01, 1.249337077381069833e-01], 
-[1.204503540258782370e-03, 9.000000000000000222e-01, 2.955163760652946836e-01], 
-[1.204503540258782370e-03, 9.020408163265306589e-01, 3.020733704042843915e-01], 
-[1.204503540258782370e-03, 9.040816326530612956e-01, 3.089056550499479359e-01], 
-[1.204503540258782370e-03, 9.061224489795918213e-01, 3.160309644954560904e-01], 
-[1.204503540258782370e-03, 9.081632653061224580e-01, 3.234685951837716900e-01], 
-[1.204503540258782370e-03, 9.102040816326530948e-01, 3.312395816914647795e-01], 
-[1.204503540258782370e-03, 9.122448979591837315e-01, 3.393668973436879677e-01], 
-[1.204503540258782370e-03, 9.142857142857142572e-01, 3.478756833102918389e-01], 
-[1.204503540258782370e-03, 9.163265306122448939e-01, 3.567935110195073478e-01], 
-[1.204503540258782370e-03, 9.183673469387755306e-01, 3.661506836883511862e-01], 
-[1.204503540258782370e-03, 9.204081632653061673e-01, 3.759805839527491367e-01], 
-[1.204503540258782370e-03, 9.224489795918368040e-01, 3.863200760434624681e-01], 
-[1.204503540258782370e-03, 9.244897959183673297e-01, 3.972099727713360728e-01], 
-[1.204503540258782370e-03, 9.265306122448979664e-01, 4.086955798551871188e-01], 
-[1.204503540258782370e-03, 9.285714285714286031e-01, 4.208273329765844784e-01], 
-[1.204503540258782370e-03, 9.306122448979592399e-01, 4.336615465481733489e-01], 
-[1.204503540258782370e-03, 9.326530612244897656e-01, 4.472612977626401198e-01], 
-[1.204503540258782370e-03, 9.346938775510204023e-01, 4.616974753525832087e-01], 
-[1.204503540258782370e-03, 9.367346938775510390e-01, 4.770500300494487367e-01], 
-[1.204503540258782370e-03, 9.387755102040816757e-01, 4.934094735449458535e-01], 
-[1.204503540258782370e-03, 9.408163265306123124e-01, 5.108786856062320636e-01], 
-[1.204503540258782370e-03, 9.428571428571428381e-01, 5.295751059554374418e-01], 
-[1.204503540258782370e-03, 9.448979591836734748e-01, 5.496334101111924886e-01], 
-[1.204503540258782370e-03, 9.469387755102041115e-01, 5.712087987605256600e-01], 
-[1.204503540258782370e-03, 9.489795918367347483e-01, 5.944810714843519195e-01], 
-[1.204503540258782370e-03, 9.510204081632652739e-01, 6.196597123151335040e-01], 
-[1.204503540258782370e-03, 9.530612244897959107e-01, 6.469902933291752367e-01], 
-[1.204503540258782370e-03, 9.551020408163265474e-01, 6.767626132571991082e-01], 
-[1.204503540258782370e-03, 9.571428571428571841e-01, 7.093211461366168979e-01], 
-[1.204503540258782370e-03, 9.591836734693878208e-01, 7.450786038553207646e-01], 
-[1.204503540258782370e-03, 9.612244897959183465e-01, 7.845337531461364922e-01], 
-[1.204503540258782370e-03, 9.632653061224489832e-01, 8.282951318574032218e-01], 
-[1.204503540258782370e-03, 9.653061224489796199e-01, 8.771130792789321173e-01], 
-[1.204503540258782370e-03, 9.673469387755102566e-01, 9.319236962598809182e-01], 
-[1.204503540258782370e-03, 9.693877551020407823e-01, 9.939102688575314204e-01], 
-[1.204503540258782370e-03, 9.714285714285714191e-01, 1.064590834136051711e+00], 
-[1.204503540258782370e-03, 9.734693877551020558e-01, 1.145945877856792805e+00], 
-[1.204503540258782370e-03, 9.755102040816326925e-01, 1.240609427813237575e+00], 
-[1.204503540258782370e-03, 9.775510204081632182e-01, 1.352163628645272286e+00], 
-[1.204503540258782370e-03, 9.795918367346938549e-01, 1.485608764707910590e+00], 
-[1.204503540258782370e-03, 9.816326530612244916e-01, 1.648144283261692156e+00], 
-[1.204503540258782370e-03, 9.836734693877551283e-01, 1.850531082267816929e+00], 
-[1.204503540258782370e-03, 9.857142857142857650e-01, 2.109612213434391759e+00], 
-[1.204503540258782370e-03, 9.877551020408162907e-01, 2.453333500268722212e+00], 
-[1.204503540258782370e-03, 9.897959183673469274e-01, 2.931736623738145031e+00], 
-[1.204503540258782370e-03, 9.918367346938775642e-01, 3.644288571375429164e+00], 
-[1.204503540258782370e-03, 9.938775510204082009e-01, 4.821308880990301304e+00], 
-[1.204503540258782370e-03, 9.959183673469387266e-01, 7.146738439643789853e+00], 
-[1.204503540258782370e-03, 9.979591836734693633e-01, 1.398561752235064226e+01], 
-[1.204503540258782370e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.321941148466028622e-03, 1.000000000000000021e-03, 1.859256401540410053e-02], 
-[1.321941148466028622e-03, 1.148922311909569708e-03, 1.858404929112780074e-02], 
-[1.321941148466028622e-03, 1.320022478803632065e-03, 1.857593182111912794e-02], 
-[1.321941148466028622e-03, 1.516603278119670137e-03, 1.856827113197317969e-02], 
-[1.321941148466028622e-03, 1.742459344546885402e-03, 1.856113577760502842e-02], 
-[1.321941148466028622e-03, 2.001950418545241171e-03, 1.855460474242605698e-02], 
-[1.321941148466028622e-03, 2.300085503203331758e-03, 1.854876907340708564e-02], 
-[1.321941148466028622e-03, 2.642619553930058204e-03, 1.854373378164875241e-02], 
-[1.321941148466028622e-03, 3.036164567398761706e-03, 1.853962006249524827e-02], 
-[1.321941148466028622e-03, 3.488317214113704091e-03, 1.853656789304213709e-02], 
-[1.321941148466028622e-03, 4.007805478313466660e-03, 1.853473907895029915e-02], 
-[1.321941148466028622e-03, 4.604657135827751671e-03, 1.853432083800723301e-02], 
-[1.321941148466028622e-03, 5.290393322046124149e-03, 1.853553002791475182e-02], 
-[1.321941148466028622e-03, 6.078250926476181683e-03, 1.853861815097979787e-02], 
-[1.321941148466028622e-03, 6.983438106813499684e-03, 1.854387730048514399e-02], 
-[1.321941148466028622e-03, 8.023427854757562983e-03, 1.855164725481106558e-02], 
-[1.321941148466028622e-03, 9.218295280327699903e-03, 1.856232397833562295e-02], 
-[1.321941148466028622e-03, 1.059110512533918171e-02, 1.857636985736582647e-02], 
-[1.321941148466028622e-03, 1.216835698628199354e-02, 1.859432608939237674e-02], 
-[1.321941148466028622e-03, 1.398049684082008047e-02, 1.861682776268925796e-02], 
-[1.321941148466028622e-03, 1.606250475199945058e-02, 1.864462232048187673e-02], 
-[1.321941148466028622e-03, 1.845457009472566828e-02, 1.867859231368521056e-02], 
-[1.321941148466028622e-03, 2.120286733852943389e-02, 1.871978362823978337e-02], 
-[1.321941148466028622e-03, 2.436044736169515681e-02, 1.876944075522252869e-02], 
-[1.321941148466028622e-03, 2.798826150195019707e-02, 1.882905119422225923e-02], 
-[1.321941148466028622e-03, 3.215633811115024138e-02, 1.890040180054174124e-02], 
-[1.321941148466028622e-03, 3.694513432520856594e-02, 1.898565088975169221e-02], 
-[1.321941148466028622e-03, 4.244708914272822542e-02, 1.908742132438882161e-02], 
-[1.321941148466028622e-03, 4.876840779169493850e-02, 1.920892181696350065e-02], 
-[1.321941148466028622e-03, 5.603111182818285713e-02, 1.935410658065141176e-02], 
-[1.321941148466028622e-03, 6.437539454049952259e-02, 1.952788769511915046e-02], 
-[1.321941148466028622e-03, 7.396232712556144451e-02, 1.973642084467609747e-02], 
-[1.321941148466028622e-03, 8.497696787531199003e-02, 1.998749458555630631e-02], 
-[1.321941148466028622e-03, 9.763193439036874088e-02, 2.029106792103076845e-02], 
-[1.321941148466028622e-03, 1.121715077759858903e-01, 2.066002394936606798e-02], 
-[1.321941148466028622e-03, 1.288763480443681220e-01, 2.111124434892162199e-02], 
-[1.321941148466028622e-03, 1.480689117455977755e-01, 2.166717062178285386e-02], 
-[1.321941148466028622e-03, 1.701196764046864207e-01, 2.235812218412535496e-02], 
-[1.321941148466028622e-03, 1.954542919161802172e-01, 2.322582497346308700e-02], 
-[1.321941148466028622e-03, 2.245617969409859638e-01, 2.432894068924684045e-02], 
-[1.321941148466028622e-03, 2.580040589080049296e-01, 2.575203192865035962e-02], 
-[1.321941148466028622e-03, 2.964266198426381838e-01, 2.762070287761290294e-02], 
-[1.321941148466028622e-03, 3.405711573811430193e-01, 3.012846381576847823e-02], 
-[1.321941148466028622e-03, 3.912898015080607528e-01, 3.358739308174724103e-02], 
-[1.321941148466028622e-03, 4.495615833752782953e-01, 3.853132684708841099e-02], 
-[1.321941148466028622e-03, 5.165113337172515529e-01, 4.594824508699178744e-02], 
-[1.321941148466028622e-03, 5.934313956619206021e-01, 5.788036523346025419e-02], 
-[1.321941148466028622e-03, 6.818065710636164178e-01, 7.931569472666066822e-02], 
-[1.321941148466028622e-03, 7.833427819015473803e-01, 1.264490062305013152e-01], 
-[1.321941148466028622e-03, 9.000000000000000222e-01, 2.989996110275900953e-01], 
-[1.321941148466028622e-03, 9.020408163265306589e-01, 3.056312066122741644e-01], 
-[1.321941148466028622e-03, 9.040816326530612956e-01, 3.125411599804640561e-01], 
-[1.321941148466028622e-03, 9.061224489795918213e-01, 3.197474004610104670e-01], 
-[1.321941148466028622e-03, 9.081632653061224580e-01, 3.272694363097471970e-01], 
-[1.321941148466028622e-03, 9.102040816326530948e-01, 3.351285327917143952e-01], 
-[1.321941148466028622e-03, 9.122448979591837315e-01, 3.433479149558619770e-01], 
-[1.321941148466028622e-03, 9.142857142857142572e-01, 3.519529991952559667e-01], 
-[1.321941148466028622e-03, 9.163265306122448939e-01, 3.609716584805647832e-01], 
-[1.321941148466028622e-03, 9.183673469387755306e-01, 3.704345271275036877e-01], 
-[1.321941148466028622e-03, 9.204081632653061673e-01, 3.803753521552316053e-01], 
-[1.321941148466028622e-03, 9.224489795918368040e-01, 3.908313997712059562e-01], 
-[1.321941148466028622e-03, 9.244897959183673297e-01, 4.018439273545676427e-01], 
-[1.321941148466028622e-03, 9.265306122448979664e-01, 4.134587336037884864e-01], 
-[1.321941148466028622e-03, 9.285714285714286031e-01, 4.257268023951992220e-01], 
-[1.321941148466028622e-03, 9.306122448979592399e-01, 4.387050595392156804e-01], 
-[1.321941148466028622e-03, 9.326530612244897656e-01, 4.524572662495238706e-01], 
-[1.321941148466028622e-03, 9.346938775510204023e-01, 4.670550790650435102e-01], 
-[1.321941148466028622e-03, 9.367346938775510390e-01, 4.825793136013993290e-01], 
-[1.321941148466028622e-03, 9.387755102040816757e-01, 4.991214594263959081e-01], 
-[1.321941148466028622e-03, 9.408163265306123124e-01, 5.167855063358686163e-01], 
-[1.321941148466028622e-03, 9.428571428571428381e-01, 5.356901594422105450e-01], 
-[1.321941148466028622e-03, 9.448979591836734748e-01, 5.559715433099386983e-01], 
-[1.321941148466028622e-03, 9.469387755102041115e-01, 5.777865260588335161e-01], 
-[1.321941148466028622e-03, 9.489795918367347483e-01, 6.013168360379645971e-01], 
-[1.321941148466028622e-03, 9.510204081632652739e-01, 6.267742009160560679e-01], 
-[1.321941148466028622e-03, 9.530612244897959107e-01, 6.544068185715813391e-01], 
-[1.321941148466028622e-03, 9.551020408163265474e-01, 6.845075810908546332e-01], 
-[1.321941148466028622e-03, 9.571428571428571841e-01, 7.174246328509795712e-01], 
-[1.321941148466028622e-03, 9.591836734693878208e-01, 7.535750748450913417e-01], 
-[1.321941148466028622e-03, 9.612244897959183465e-01, 7.934629675743295474e-01], 
-[1.321941148466028622e-03, 9.632653061224489832e-01, 8.377032942655316949e-01], 
-[1.321941148466028622e-03, 9.653061224489796199e-01, 8.870543240025631215e-01], 
-[1.321941148466028622e-03, 9.673469387755102566e-01, 9.424620275735171582e-01], 
-[1.321941148466028622e-03, 9.693877551020407823e-01, 1.005122136369088315e+00], 
-[1.321941148466028622e-03, 9.714285714285714191e-01, 1.076568611493912808e+00], 
-[1.321941148466028622e-03, 9.734693877551020558e-01, 1.158802655188000408e+00], 
-[1.321941148466028622e-03, 9.755102040816326925e-01, 1.254485764374097867e+00], 
-[1.321941148466028622e-03, 9.775510204081632182e-01, 1.367237317701396782e+00], 
-[1.321941148466028622e-03, 9.795918367346938549e-01, 1.502109388352165453e+00], 
-[1.321941148466028622e-03, 9.816326530612244916e-01, 1.666375696897834491e+00], 
-[1.321941148466028622e-03, 9.836734693877551283e-01, 1.870907673483100053e+00], 
-[1.321941148466028622e-03, 9.857142857142857650e-01, 2.132720531452399371e+00], 
-[1.321941148466028622e-03, 9.877551020408162907e-01, 2.480044155217740798e+00], 
-[1.321941148466028622e-03, 9.897959183673469274e-01, 2.963425597273078527e+00], 
-[1.321941148466028622e-03, 9.918367346938775642e-01, 3.683328599738074249e+00], 
-[1.321941148466028622e-03, 9.938775510204082009e-01, 4.872358449024031479e+00], 
-[1.321941148466028622e-03, 9.959183673469387266e-01, 7.221155472330901048e+00], 
-[1.321941148466028622e-03, 9.979591836734693633e-01, 1.412703760558693133e+01], 
-[1.321941148466028622e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.450828778495940165e-03, 1.000000000000000021e-03, 1.883612796136749021e-02], 
-[1.450828778495940165e-03, 1.148922311909569708e-03, 1.882736150026151009e-02], 
-[1.450828778495940165e-03, 1.320022478803632065e-03, 1.881899726447453652e-02], 
-[1.450828778495940165e-03, 1.516603278119670137e-03, 1.881109552235476351e-02], 
-[1.450828778495940165e-03, 1.742459344546885402e-03, 1.880372568160178226e-02], 
-[1.450828778495940165e-03, 2.001950418545241171e-03, 1.879696770979251072e-02], 
-[1.450828778495940165e-03, 2.300085503203331758e-03, 1.879091378661423839e-02], 
-[1.450828778495940165e-03, 2.642619553930058204e-03, 1.878567022893080224e-02], 
-[1.450828778495940165e-03, 3.036164567398761706e-03, 1.878135973830467181e-02], 
-[1.450828778495940165e-03, 3.488317214113704091e-03, 1.877812403057457086e-02], 
-[1.450828778495940165e-03, 4.007805478313466660e-03, 1.877612692026195060e-02], 
-[1.450828778495940165e-03, 4.604657135827751671e-03, 1.877555794833318803e-02], 
-[1.450828778495940165e-03, 5.290393322046124149e-03, 1.877663666211449450e-02], 
-[1.450828778495940165e-03, 6.078250926476181683e-03, 1.877961768166480985e-02], 
-[1.450828778495940165e-03, 6.983438106813499684e-03, 1.878479671940934057e-02], 
-[1.450828778495940165e-03, 8.023427854757562983e-03, 1.879251776162406753e-02], 
-[1.450828778495940165e-03, 9.218295280327699903e-03, 1.880318167398881829e-02], 
-[1.450828778495940165e-03, 1.059110512533918171e-02, 1.881725656347192632e-02], 
-[1.450828778495940165e-03, 1.216835698628199354e-02, 1.883529031996752923e-02], 
-[1.450828778495940165e-03, 1.398049684082008047e-02, 1.885792588127744099e-02], 
-[1.450828778495940165e-03, 1.606250475199945058e-02, 1.888591992414943854e-02], 
-[1.450828778495940165e-03, 1.845457009472566828e-02, 1.892016589641674906e-02], 
-[1.450828778495940165e-03, 2.120286733852943389e-02, 1.896172259073991909e-02], 
-[1.450828778495940165e-03, 2.436044736169515681e-02, 1.901184984724640231e-02], 
-[1.450828778495940165e-03, 2.798826150195019707e-02, 1.907205350100598523e-02], 
-[1.450828778495940165e-03, 3.215633811115024138e-02, 1.914414241908898168e-02], 
-[1.450828778495940165e-03, 3.694513432520856594e-02, 1.923030148703693681e-02], 
-[1.450828778495940165e-03, 4.244708914272822542e-02, 1.933318583289853065e-02], 
-[1.450828778495940165e-03, 4.876840779169493850e-02, 1.945604361058395418e-02], 
-[1.450828778495940165e-03, 5.603111182818285713e-02, 1.960287759637935334e-02], 
-[1.450828778495940165e-03, 6.437539454049952259e-02, 1.977866013944386270e-02], 
-[1.450828778495940165e-03, 7.396232712556144451e-02, 1.998962237229849961e-02], 
-[1.450828778495940165e-03, 8.497696787531199003e-02, 2.024364820065205350e-02], 
-[1.450828778495940165e-03, 9.763193439036874088e-02, 2.055081838849536630e-02], 
-[1.450828778495940165e-03, 1.121715077759858903e-01, 2.092417331474683007e-02], 
-[1.450828778495940165e-03, 1.288763480443681220e-01, 2.138080041711720031e-02], 
-[1.450828778495940165e-03, 1.480689117455977755e-01, 2.194341422172621514e-02], 
-[1.450828778495940165e-03, 1.701196764046864207e-01, 2.264270225690550795e-02], 
-[1.450828778495940165e-03, 1.954542919161802172e-01, 2.352089589907777056e-02], 
-[1.450828778495940165e-03, 2.245617969409859638e-01, 2.463736560617617311e-02], 
-[1.450828778495940165e-03, 2.580040589080049296e-01, 2.607769271254993526e-02], 
-[1.450828778495940165e-03, 2.964266198426381838e-01, 2.796898962001468508e-02], 
-[1.450828778495940165e-03, 3.405711573811430193e-01, 3.050708156559228321e-02], 
-[1.450828778495940165e-03, 3.912898015080607528e-01, 3.400776432332946325e-02], 
-[1.450828778495940165e-03, 4.495615833752782953e-01, 3.901120151823286863e-02], 
-[1.450828778495940165e-03, 5.165113337172515529e-01, 4.651701487367052024e-02], 
-[1.450828778495940165e-03, 5.934313956619206021e-01, 5.859131515973545895e-02], 
-[1.450828778495940165e-03, 6.818065710636164178e-01, 8.027994306877862807e-02], 
-[1.450828778495940165e-03, 7.833427819015473803e-01, 1.279631148176403332e-01], 
-[1.450828778495940165e-03, 9.000000000000000222e-01, 3.024776504223771756e-01], 
-[1.450828778495940165e-03, 9.020408163265306589e-01, 3.091836696071011414e-01], 
-[1.450828778495940165e-03, 9.040816326530612956e-01, 3.161711051433899744e-01], 
-[1.450828778495940165e-03, 9.061224489795918213e-01, 3.234580805608542331e-01], 
-[1.450828778495940165e-03, 9.081632653061224580e-01, 3.310643152333982986e-01], 
-[1.450828778495940165e-03, 9.102040816326530948e-01, 3.390113043527413494e-01], 
-[1.450828778495940165e-03, 9.122448979591837315e-01, 3.473225238547130167e-01], 
-[1.450828778495940165e-03, 9.142857142857142572e-01, 3.560236644342097412e-01], 
-[1.450828778495940165e-03, 9.163265306122448939e-01, 3.651428995877342154e-01], 
-[1.450828778495940165e-03, 9.183673469387755306e-01, 3.747111936054536852e-01], 
-[1.450828778495940165e-03, 9.204081632653061673e-01, 3.847626566434726447e-01], 
-[1.450828778495940165e-03, 9.224489795918368040e-01, 3.953349555008668359e-01], 
-[1.450828778495940165e-03, 9.244897959183673297e-01, 4.064697905816450629e-01], 
-[1.450828778495940165e-03, 9.265306122448979664e-01, 4.182134518392294220e-01], 
-[1.450828778495940165e-03, 9.285714285714286031e-01, 4.306174694117416157e-01], 
-[1.450828778495940165e-03, 9.306122448979592399e-01, 4.437393783342190590e-01], 
-[1.450828778495940165e-03, 9.326530612244897656e-01, 4.576436213901168837e-01], 
-[1.450828778495940165e-03, 9.346938775510204023e-01, 4.724026201501180799e-01], 
-[1.450828778495940165e-03, 9.367346938775510390e-01, 4.880980519618534630e-01], 
-[1.450828778495940165e-03, 9.387755102040816757e-01, 5.048223806739389197e-01], 
-[1.450828778495940165e-03, 9.408163265306123124e-01, 5.226807019930063136e-01], 
-[1.450828778495940165e-03, 9.428571428571428381e-01, 5.417929816841744461e-01], 
-[1.450828778495940165e-03, 9.448979591836734748e-01, 5.622967878813358578e-01], 
-[1.450828778495940165e-03, 9.469387755102041115e-01, 5.843506497738212291e-01], 
-[1.450828778495940165e-03, 9.489795918367347483e-01, 6.081382170446816282e-01], 
-[1.450828778495940165e-03, 9.510204081632652739e-01, 6.338734522619728917e-01], 
-[1.450828778495940165e-03, 9.530612244897959107e-01, 6.618071687725306518e-01], 
-[1.450828778495940165e-03, 9.551020408163265474e-01, 6.922353397107865458e-01], 
-[1.450828778495940165e-03, 9.571428571428571841e-01, 7.255097650246618013e-01], 
-[1.450828778495940165e-03, 9.591836734693878208e-01, 7.620519169437807161e-01], 
-[1.450828778495940165e-03, 9.612244897959183465e-01, 8.023711279228040727e-01], 
-[1.450828778495940165e-03, 9.632653061224489832e-01, 8.470887996695912747e-01], 
-[1.450828778495940165e-03, 9.653061224489796199e-01, 8.969710975322008339e-01], 
-[1.450828778495940165e-03, 9.673469387755102566e-01, 9.529738199274385702e-01], 
-[1.450828778495940165e-03, 9.693877551020407823e-01, 1.016305089456497335e+00], 
-[1.450828778495940165e-03, 9.714285714285714191e-01, 1.088514720959121052e+00], 
-[1.450828778495940165e-03, 9.734693877551020558e-01, 1.171624540221184230e+00], 
-[1.450828778495940165e-03, 9.755102040816326925e-01, 1.268323387974040539e+00], 
-[1.450828778495940165e-03, 9.775510204081632182e-01, 1.382267703930409208e+00], 
-[1.450828778495940165e-03, 9.795918367346938549e-01, 1.518561104887194535e+00], 
-[1.450828778495940165e-03, 9.816326530612244916e-01, 1.684551225707131783e+00], 
-[1.450828778495940165e-03, 9.836734693877551283e-01, 1.891219482302407995e+00], 
-[1.450828778495940165e-03, 9.857142857142857650e-01, 2.155752377355133032e+00], 
-[1.450828778495940165e-03, 9.877551020408162907e-01, 2.506662376989049701e+00], 
-[1.450828778495940165e-03, 9.897959183673469274e-01, 2.994999190889588991e+00], 
-[1.450828778495940165e-03, 9.918367346938775642e-01, 3.722217766741467315e+00], 
-[1.450828778495940165e-03, 9.938775510204082009e-01, 4.923195853357215768e+00], 
-[1.450828778495940165e-03, 9.959183673469387266e-01, 7.295232054249906284e+00], 
-[1.450828778495940165e-03, 9.979591836734693633e-01, 1.426770640734796025e+01], 
-[1.450828778495940165e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.592282793341092241e-03, 1.000000000000000021e-03, 1.908003639918445793e-02], 
-[1.592282793341092241e-03, 1.148922311909569708e-03, 1.907101444157304274e-02], 
-[1.592282793341092241e-03, 1.320022478803632065e-03, 1.906239968162756065e-02], 
-[1.592282793341092241e-03, 1.516603278119670137e-03, 1.905425312956828682e-02], 
-[1.592282793341092241e-03, 1.742459344546885402e-03, 1.904664504700552541e-02], 
-[1.592282793341092241e-03, 2.001950418545241171e-03, 1.903965638481459194e-02], 
-[1.592282793341092241e-03, 2.300085503203331758e-03, 1.903338045553820690e-02], 
-[1.592282793341092241e-03, 2.642619553930058204e-03, 1.902792488194691295e-02], 
-[1.592282793341092241e-03, 3.036164567398761706e-03, 1.902341387196876746e-02], 
-[1.592282793341092241e-03, 3.488317214113704091e-03, 1.901999088033410473e-02], 
-[1.592282793341092241e-03, 4.007805478313466660e-03, 1.901782173057186415e-02], 
-[1.592282793341092241e-03, 4.604657135827751671e-03, 1.901709828696909049e-02], 
-[1.592282793341092241e-03, 5.290393322046124149e-03, 1.901804278661768655e-02], 
-[1.592282793341092241e-03, 6.078250926476181683e-03, 1.902091296741553750e-02], 
-[1.592282793341092241e-03, 6.983438106813499684e-03, 1.902600816104980247e-02], 
-[1.592282793341092241e-03, 8.023427854757562983e-03, 1.903367656173883538e-02], 
-[1.592282793341092241e-03, 9.218295280327699903e-03, 1.904432393647181518e-02], 
-[1.592282793341092241e-03, 1.059110512533918171e-02, 1.905842411281967116e-02], 
-[1.592282793341092241e-03, 1.216835698628199354e-02, 1.907653167293207885e-02], 
-[1.592282793341092241e-03, 1.398049684082008047e-02, 1.909929740387123973e-02], 
-[1.592282793341092241e-03, 1.606250475199945058e-02, 1.912748721548056252e-02], 
-[1.592282793341092241e-03, 1.845457009472566828e-02, 1.916200545187249360e-02], 
-[1.592282793341092241e-03, 2.120286733852943389e-02, 1.920392381150528432e-02], 
-[1.592282793341092241e-03, 2.436044736169515681e-02, 1.925451748225521370e-02], 
-[1.592282793341092241e-03, 2.798826150195019707e-02, 1.931531063286097069e-02], 
-[1.592282793341092241e-03, 3.215633811115024138e-02, 1.938813413965703378e-02], 
-[1.592282793341092241e-03, 3.694513432520856594e-02, 1.947519945470973374e-02], 
-[1.592282793341092241e-03, 4.244708914272822542e-02, 1.957919396683720226e-02], 
-[1.592282793341092241e-03, 4.876840779169493850e-02, 1.970340526480830398e-02], 
-[1.592282793341092241e-03, 5.603111182818285713e-02, 1.985188467895916339e-02], 
-[1.592282793341092241e-03, 6.437539454049952259e-02, 2.002966481531637255e-02], 
-[1.592282793341092241e-03, 7.396232712556144451e-02, 2.024305223688949856e-02], 
-[1.592282793341092241e-03, 8.497696787531199003e-02, 2.050002617376418118e-02], 
-[1.592282793341092241e-03, 9.763193439036874088e-02, 2.081078911475342519e-02], 
-[1.592282793341092241e-03, 1.121715077759858903e-01, 2.118853866750269876e-02], 
-[1.592282793341092241e-03, 1.288763480443681220e-01, 2.165056795301443723e-02], 
-[1.592282793341092241e-03, 1.480689117455977755e-01, 2.221986440844045743e-02], 
-[1.592282793341092241e-03, 1.701196764046864207e-01, 2.292748350366162480e-02], 
-[1.592282793341092241e-03, 1.954542919161802172e-01, 2.381616179164271208e-02], 
-[1.592282793341092241e-03, 2.245617969409859638e-01, 2.494597807657056993e-02], 
-[1.592282793341092241e-03, 2.580040589080049296e-01, 2.640353176561784088e-02], 
-[1.592282793341092241e-03, 2.964266198426381838e-01, 2.831744237249130339e-02], 
-[1.592282793341092241e-03, 3.405711573811430193e-01, 3.088584818650909336e-02], 
-[1.592282793341092241e-03, 3.912898015080607528e-01, 3.442825896934315066e-02], 
-[1.592282793341092241e-03, 4.495615833752782953e-01, 3.949115916204588156e-02], 
-[1.592282793341092241e-03, 5.165113337172515529e-01, 4.708579835048290474e-02], 
-[1.592282793341092241e-03, 5.934313956619206021e-01, 5.930214797217740752e-02], 
-[1.592282793341092241e-03, 6.818065710636164178e-01, 8.124379008061183294e-02], 
-[1.592282793341092241e-03, 7.833427819015473803e-01, 1.294760330961304828e-01], 
-[1.592282793341092241e-03, 9.000000000000000222e-01, 3.059504974941396060e-01], 
-[1.592282793341092241e-03, 9.020408163265306589e-01, 3.127307628490915148e-01], 
-[1.592282793341092241e-03, 9.040816326530612956e-01, 3.197954942291206804e-01], 
-[1.592282793341092241e-03, 9.061224489795918213e-01, 3.271630087308593504e-01], 
-[1.592282793341092241e-03, 9.081632653061224580e-01, 3.348532361527855050e-01], 
-[1.592282793341092241e-03, 9.102040816326530948e-01, 3.428879008529505112e-01], 
-[1.592282793341092241e-03, 9.122448979591837315e-01, 3.512907288187464006e-01], 
-[1.592282793341092241e-03, 9.142857142857142572e-01, 3.600876841272956930e-01], 
-[1.592282793341092241e-03, 9.163265306122448939e-01, 3.693072397863132461e-01], 
-[1.592282793341092241e-03, 9.183673469387755306e-01, 3.789806889383861566e-01], 
-[1.592282793341092241e-03, 9.204081632653061673e-01, 3.891425036327557097e-01], 
-[1.592282793341092241e-03, 9.224489795918368040e-01, 3.998307498778194136e-01], 
-[1.592282793341092241e-03, 9.244897959183673297e-01, 4.110875695621582504e-01], 
-[1.592282793341092241e-03, 9.265306122448979664e-01, 4.229597421729756057e-01], 
-[1.592282793341092241e-03, 9.285714285714286031e-01, 4.354993421812175525e-01], 
-[1.592282793341092241e-03, 9.306122448979592399e-01, 4.487645116779440668e-01], 
-[1.592282793341092241e-03, 9.326530612244897656e-01, 4.628203725703362026e-01], 
-[1.592282793341092241e-03, 9.346938775510204023e-01, 4.777401086922183904e-01], 
-[1.592282793341092241e-03, 9.367346938775510390e-01, 4.936062559778747749e-01], 
-[1.592282793341092241e-03, 9.387755102040816757e-01, 5.105122489693147969e-01], 
-[1.592282793341092241e-03, 9.408163265306123124e-01, 5.285642851752011540e-01], 
-[1.592282793341092241e-03, 9.428571428571428381e-01, 5.478835862864507300e-01], 
-[1.592282793341092241e-03, 9.448979591836734748e-01, 5.686091585422348160e-01], 
-[1.592282793341092241e-03, 9.469387755102041115e-01, 5.909011858528332439e-01], 
-[1.592282793341092241e-03, 9.489795918367347483e-01, 6.149452318183794564e-01], 
-[1.592282793341092241e-03, 9.510204081632652739e-01, 6.409574851898932613e-01], 
-[1.592282793341092241e-03, 9.530612244897959107e-01, 6.691913644734109878e-01], 
-[1.592282793341092241e-03, 9.551020408163265474e-01, 6.999459115737555193e-01], 
-[1.592282793341092241e-03, 9.571428571428571841e-01, 7.335765672769860579e-01], 
-[1.592282793341092241e-03, 9.591836734693878208e-01, 7.705091572248883303e-01], 
-[1.592282793341092241e-03, 9.612244897959183465e-01, 8.112582640658867472e-01], 
-[1.592282793341092241e-03, 9.632653061224489832e-01, 8.564516811602884694e-01], 
-[1.592282793341092241e-03, 9.653061224489796199e-01, 9.068634366777347244e-01], 
-[1.592282793341092241e-03, 9.673469387755102566e-01, 9.634591144654320871e-01], 
-[1.592282793341092241e-03, 9.693877551020407823e-01, 1.027459174357763239e+00], 
-[1.592282793341092241e-03, 9.714285714285714191e-01, 1.100429214816742718e+00], 
-[1.592282793341092241e-03, 9.734693877551020558e-01, 1.184411592500548505e+00], 
-[1.592282793341092241e-03, 9.755102040816326925e-01, 1.282122366984994155e+00], 
-[1.592282793341092241e-03, 9.775510204081632182e-01, 1.397254866602667400e+00], 
-[1.592282793341092241e-03, 9.795918367346938549e-01, 1.534964007280200438e+00], 
-[1.592282793341092241e-03, 9.816326530612244916e-01, 1.702670980242571908e+00], 
-[1.592282793341092241e-03, 9.836734693877551283e-01, 1.911466642455361686e+00], 
-[1.592282793341092241e-03, 9.857142857142857650e-01, 2.178707916431594338e+00], 
-[1.592282793341092241e-03, 9.877551020408162907e-01, 2.533188375692130734e+00], 
-[1.592282793341092241e-03, 9.897959183673469274e-01, 3.026457682035580632e+00], 
-[1.592282793341092241e-03, 9.918367346938775642e-01, 3.760956459354277914e+00], 
-[1.592282793341092241e-03, 9.938775510204082009e-01, 4.973821681939342376e+00], 
-[1.592282793341092241e-03, 9.959183673469387266e-01, 7.368969227532824462e+00], 
-[1.592282793341092241e-03, 9.979591836734693633e-01, 1.440762659928892830e+01], 
-[1.592282793341092241e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.747528400007682938e-03, 1.000000000000000021e-03, 1.932428957118067364e-02], 
-[1.747528400007682938e-03, 1.148922311909569708e-03, 1.931500835068700184e-02], 
-[1.747528400007682938e-03, 1.320022478803632065e-03, 1.930613930149317065e-02], 
-[1.747528400007682938e-03, 1.516603278119670137e-03, 1.929774417580937262e-02], 
-[1.747528400007682938e-03, 1.742459344546885402e-03, 1.928989408928137236e-02], 
-[1.747528400007682938e-03, 2.001950418545241171e-03, 1.928267097621421192e-02], 
-[1.747528400007682938e-03, 2.300085503203331758e-03, 1.927616928214306163e-02], 
-[1.747528400007682938e-03, 2.642619553930058204e-03, 1.927049793588665044e-02], 
-[1.747528400007682938e-03, 3.036164567398761706e-03, 1.926578265188352845e-02], 
-[1.747528400007682938e-03, 3.488317214113704091e-03, 1.926216862390127404e-02], 
-[1.747528400007682938e-03, 4.007805478313466660e-03, 1.925982368462005739e-02], 
-[1.747528400007682938e-03, 4.604657135827751671e-03, 1.925894202178572018e-02], 
-[1.747528400007682938e-03, 5.290393322046124149e-03, 1.925974856237289146e-02], 
-[1.747528400007682938e-03, 6.078250926476181683e-03, 1.926250416226056236e-02], 
-[1.747528400007682938e-03, 6.983438106813499684e-03, 1.926751177245164537e-02], 
-[1.747528400007682938e-03, 8.023427854757562983e-03, 1.927512379516709007e-02], 
-[1.747528400007682938e-03, 9.218295280327699903e-03, 1.928575089870541992e-02], 
-[1.747528400007682938e-03, 1.059110512533918171e-02, 1.929987263117278334e-02], 
-[1.747528400007682938e-03, 1.216835698628199354e-02, 1.931805026681620782e-02], 
-[1.747528400007682938e-03, 1.398049684082008047e-02, 1.934094244167900573e-02], 
-[1.747528400007682938e-03, 1.606250475199945058e-02, 1.936932429825961866e-02], 
-[1.747528400007682938e-03, 1.845457009472566828e-02, 1.940411107629439608e-02], 
-[1.747528400007682938e-03, 2.120286733852943389e-02, 1.944638737909787363e-02], 
-[1.747528400007682938e-03, 2.436044736169515681e-02, 1.949744374097081220e-02], 
-[1.747528400007682938e-03, 2.798826150195019707e-02, 1.955882266248192697e-02], 
-[1.747528400007682938e-03, 3.215633811115024138e-02, 1.963237702669467372e-02], 
-[1.747528400007682938e-03, 3.694513432520856594e-02, 1.972034484871595245e-02], 
-[1.747528400007682938e-03, 4.244708914272822542e-02, 1.982544577334501013e-02], 
-[1.747528400007682938e-03, 4.876840779169493850e-02, 1.995100681761288741e-02], 
-[1.747528400007682938e-03, 5.603111182818285713e-02, 2.010112785677796790e-02], 
-[1.747528400007682938e-03, 6.437539454049952259e-02, 2.028090174102698678e-02], 
-[1.747528400007682938e-03, 7.396232712556144451e-02, 2.049671044603372516e-02], 
-[1.747528400007682938e-03, 8.497696787531199003e-02, 2.075662850103732193e-02], 
-[1.747528400007682938e-03, 9.763193439036874088e-02, 2.107098008361849711e-02], 
-[1.747528400007682938e-03, 1.121715077759858903e-01, 2.145311997802766546e-02], 
-[1.747528400007682938e-03, 1.288763480443681220e-01, 2.192054691224859173e-02], 
-[1.747528400007682938e-03, 1.480689117455977755e-01, 2.249652112114158137e-02], 
-[1.747528400007682938e-03, 1.701196764046864207e-01, 2.321246584511409833e-02], 
-[1.747528400007682938e-03, 1.954542919161802172e-01, 2.411162255076302469e-02], 
-[1.747528400007682938e-03, 2.245617969409859638e-01, 2.525477797558305787e-02], 
-[1.747528400007682938e-03, 2.580040589080049296e-01, 2.672954893426361667e-02], 
-[1.747528400007682938e-03, 2.964266198426381838e-01, 2.866606094713810768e-02], 
-[1.747528400007682938e-03, 3.405711573811430193e-01, 3.126476344901595733e-02], 
-[1.747528400007682938e-03, 3.912898015080607528e-01, 3.484887673914940920e-02], 
-[1.747528400007682938e-03, 4.495615833752782953e-01, 3.997119943445701790e-02], 
-[1.747528400007682938e-03, 5.165113337172515529e-01, 4.765459509516122016e-02], 
-[1.747528400007682938e-03, 5.934313956619206021e-01, 6.001286315781319963e-02], 
-[1.747528400007682938e-03, 6.818065710636164178e-01, 8.220723517735764596e-02], 
-[1.747528400007682938e-03, 7.833427819015473803e-01, 1.309877606647983361e-01], 
-[1.747528400007682938e-03, 9.000000000000000222e-01, 3.094181554908325693e-01], 
-[1.747528400007682938e-03, 9.020408163265306589e-01, 3.162724898019890762e-01], 
-[1.747528400007682938e-03, 9.040816326530612956e-01, 3.234143309314044812e-01], 
-[1.747528400007682938e-03, 9.061224489795918213e-01, 3.308621889101734381e-01], 
-[1.747528400007682938e-03, 9.081632653061224580e-01, 3.386362032691552226e-01], 
-[1.747528400007682938e-03, 9.102040816326530948e-01, 3.467583267738271191e-01], 
-[1.747528400007682938e-03, 9.122448979591837315e-01, 3.552525346294262976e-01], 
-[1.747528400007682938e-03, 9.142857142857142572e-01, 3.641450633774742096e-01], 
-[1.747528400007682938e-03, 9.163265306122448939e-01, 3.734646845242557411e-01], 
-[1.747528400007682938e-03, 9.183673469387755306e-01, 3.832430189449569369e-01], 
-[1.747528400007682938e-03, 9.204081632653061673e-01, 3.935148993406217821e-01], 
-[1.747528400007682938e-03, 9.224489795918368040e-01, 4.043187895494525508e-01], 
-[1.747528400007682938e-03, 9.244897959183673297e-01, 4.156972714074343989e-01], 
-[1.747528400007682938e-03, 9.265306122448979664e-01, 4.276976122179143025e-01], 
-[1.747528400007682938e-03, 9.285714285714286031e-01, 4.403724288596946868e-01], 
-[1.747528400007682938e-03, 9.306122448979592399e-01, 4.537804683158028762e-01], 
-[1.747528400007682938e-03, 9.326530612244897656e-01, 4.679875291762829459e-01], 
-[1.747528400007682938e-03, 9.346938775510204023e-01, 4.830675547754075261e-01], 
-[1.747528400007682938e-03, 9.367346938775510390e-01, 4.991039364955703883e-01], 
-[1.747528400007682938e-03, 9.387755102040816757e-01, 5.161910759926126024e-01], 
-[1.747528400007682938e-03, 9.408163265306123124e-01, 5.344362684775636474e-01], 
-[1.747528400007682938e-03, 9.428571428571428381e-01, 5.539619868508049993e-01], 
-[1.747528400007682938e-03, 9.448979591836734748e-01, 5.749086700050838328e-01], 
-[1.747528400007682938e-03, 9.469387755102041115e-01, 5.974381502376080455e-01], 
-[1.747528400007682938e-03, 9.489795918367347483e-01, 6.217378976659392320e-01], 
-[1.747528400007682938e-03, 9.510204081632652739e-01, 6.480263185282245653e-01], 
-[1.747528400007682938e-03, 9.530612244897959107e-01, 6.765594262051404240e-01], 
-[1.747528400007682938e-03, 9.551020408163265474e-01, 7.076393191238730118e-01], 
-[1.747528400007682938e-03, 9.571428571428571841e-01, 7.416250642120758574e-01], 
-[1.747528400007682938e-03, 9.591836734693878208e-01, 7.789468227437117420e-01], 
-[1.747528400007682938e-03, 9.612244897959183465e-01, 8.201244058561497630e-01], 
-[1.747528400007682938e-03, 9.632653061224489832e-01, 8.657919718023437960e-01], 
-[1.747528400007682938e-03, 9.653061224489796199e-01, 9.167313782179935533e-01], 
-[1.747528400007682938e-03, 9.673469387755102566e-01, 9.739179522940895062e-01], 
-[1.747528400007682938e-03, 9.693877551020407823e-01, 1.038584437266215410e+00], 
-[1.747528400007682938e-03, 9.714285714285714191e-01, 1.112312145297948529e+00], 
-[1.747528400007682938e-03, 9.734693877551020558e-01, 1.197163871504941079e+00], 
-[1.747528400007682938e-03, 9.755102040816326925e-01, 1.295882769698959214e+00], 
-[1.747528400007682938e-03, 9.775510204081632182e-01, 1.412198884889929396e+00], 
-[1.747528400007682938e-03, 9.795918367346938549e-01, 1.551318188375323093e+00], 
-[1.747528400007682938e-03, 9.816326530612244916e-01, 1.720735070901313835e+00], 
-[1.747528400007682938e-03, 9.836734693877551283e-01, 1.931649287470568410e+00], 
-[1.747528400007682938e-03, 9.857142857142857650e-01, 2.201587313705256399e+00], 
-[1.747528400007682938e-03, 9.877551020408162907e-01, 2.559622361074499253e+00], 
-[1.747528400007682938e-03, 9.897959183673469274e-01, 3.057801347643820833e+00], 
-[1.747528400007682938e-03, 9.918367346938775642e-01, 3.799545063764829145e+00], 
-[1.747528400007682938e-03, 9.938775510204082009e-01, 5.024236521416233003e+00], 
-[1.747528400007682938e-03, 9.959183673469387266e-01, 7.442368031713656684e+00], 
-[1.747528400007682938e-03, 9.979591836734693633e-01, 1.454680084518222216e+01], 
-[1.747528400007682938e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.917910261672488683e-03, 1.000000000000000021e-03, 1.956888771975322933e-02], 
-[1.917910261672488683e-03, 1.148922311909569708e-03, 1.955934346329526313e-02], 
-[1.917910261672488683e-03, 1.320022478803632065e-03, 1.955021635304954666e-02], 
-[1.917910261672488683e-03, 1.516603278119670137e-03, 1.954156888333273209e-02], 
-[1.917910261672488683e-03, 1.742459344546885402e-03, 1.953347302394946999e-02], 
-[1.917910261672488683e-03, 2.001950418545241171e-03, 1.952601169276413362e-02], 
-[1.917910261672488683e-03, 2.300085503203331758e-03, 1.951928046843966202e-02], 
-[1.917910261672488683e-03, 2.642619553930058204e-03, 1.951338958598230339e-02], 
-[1.917910261672488683e-03, 3.036164567398761706e-03, 1.950846626648354912e-02], 
-[1.917910261672488683e-03, 3.488317214113704091e-03, 1.950465744289110043e-02], 
-[1.917910261672488683e-03, 4.007805478313466660e-03, 1.950213295717696110e-02], 
-[1.917910261672488683e-03, 4.604657135827751671e-03, 1.950108932068017609e-02], 
-[1.917910261672488683e-03, 5.290393322046124149e-03, 1.950175415038152976e-02], 
-[1.917910261672488683e-03, 6.078250926476181683e-03, 1.950439142024659733e-02], 
-[1.917910261672488683e-03, 6.983438106813499684e-03, 1.950930770067404313e-02], 
-[1.917910261672488683e-03, 8.023427854757562983e-03, 1.951685960193053765e-02], 
-[1.917910261672488683e-03, 9.218295280327699903e-03, 1.952746269361639239e-02], 
-[1.917910261672488683e-03, 1.059110512533918171e-02, 1.954160224429680320e-02], 
-[1.917910261672488683e-03, 1.216835698628199354e-02, 1.955984622014788482e-02], 
-[1.917910261672488683e-03, 1.398049684082008047e-02, 1.958286110590287676e-02], 
-[1.917910261672488683e-03, 1.606250475199945058e-02, 1.961143127626076288e-02], 
-[1.917910261672488683e-03, 1.845457009472566828e-02, 1.964648286591025653e-02], 
-[1.917910261672488683e-03, 2.120286733852943389e-02, 1.968911338206157796e-02], 
-[1.917910261672488683e-03, 2.436044736169515681e-02, 1.974062870409305087e-02], 
-[1.917910261672488683e-03, 2.798826150195019707e-02, 1.980258966253779090e-02], 
-[1.917910261672488683e-03, 3.215633811115024138e-02, 1.987687114462114574e-02], 
-[1.917910261672488683e-03, 3.694513432520856594e-02, 1.996573772496827021e-02], 
-[1.917910261672488683e-03, 4.244708914272822542e-02, 2.007194129952542122e-02], 
-[1.917910261672488683e-03, 4.876840779169493850e-02, 2.019884830693400440e-02], 
-[1.917910261672488683e-03, 5.603111182818285713e-02, 2.035060715817973293e-02], 
-[1.917910261672488683e-03, 6.437539454049952259e-02, 2.053237093481998649e-02], 
-[1.917910261672488683e-03, 7.396232712556144451e-02, 2.075059700726729350e-02], 
-[1.917910261672488683e-03, 8.497696787531199003e-02, 2.101345517856553421e-02], 
-[1.917910261672488683e-03, 9.763193439036874088e-02, 2.133139127885215480e-02], 
-[1.917910261672488683e-03, 1.121715077759858903e-01, 2.171791721666314900e-02], 
-[1.917910261672488683e-03, 1.288763480443681220e-01, 2.219073725040287756e-02], 
-[1.917910261672488683e-03, 1.480689117455977755e-01, 2.277338429899558592e-02], 
-[1.917910261672488683e-03, 1.701196764046864207e-01, 2.349764920193745180e-02], 
-[1.917910261672488683e-03, 1.954542919161802172e-01, 2.440727807600487353e-02], 
-[1.917910261672488683e-03, 2.245617969409859638e-01, 2.556376517833883200e-02], 
-[1.917910261672488683e-03, 2.580040589080049296e-01, 2.705574406488594347e-02], 
-[1.917910261672488683e-03, 2.964266198426381838e-01, 2.901484515606540110e-02], 
-[1.917910261672488683e-03, 3.405711573811430193e-01, 3.164382712366410610e-02], 
-[1.917910261672488683e-03, 3.912898015080607528e-01, 3.526961735222403083e-02], 
-[1.917910261672488683e-03, 4.495615833752782953e-01, 4.045132199160611508e-02], 
-[1.917910261672488683e-03, 5.165113337172515529e-01, 4.822340468580513934e-02], 
-[1.917910261672488683e-03, 5.934313956619206021e-01, 6.072346020431029778e-02], 
-[1.917910261672488683e-03, 6.818065710636164178e-01, 8.317027777536728506e-02], 
-[1.917910261672488683e-03, 7.833427819015473803e-01, 1.324982971246870811e-01], 
-[1.917910261672488683e-03, 9.000000000000000222e-01, 3.128806276638668171e-01], 
-[1.917910261672488683e-03, 9.020408163265306589e-01, 3.198088539329384528e-01], 
-[1.917910261672488683e-03, 9.040816326530612956e-01, 3.270276189473249051e-01], 
-[1.917910261672488683e-03, 9.061224489795918213e-01, 3.345556250412029531e-01], 
-[1.917910261672488683e-03, 9.081632653061224580e-01, 3.424132207869212685e-01], 
-[1.917910261672488683e-03, 9.102040816326530948e-01, 3.506225865999182956e-01], 
-[1.917910261672488683e-03, 9.122448979591837315e-01, 3.592079460711563588e-01], 
-[1.917910261672488683e-03, 9.142857142857142572e-01, 3.681958072905032187e-01], 
-[1.917910261672488683e-03, 9.163265306122448939e-01, 3.776152392521505696e-01], 
-[1.917910261672488683e-03, 9.183673469387755306e-01, 3.874981894462700138e-01], 
-[1.917910261672488683e-03, 9.204081632653061673e-01, 3.978798499868477223e-01], 
-[1.917910261672488683e-03, 9.224489795918368040e-01, 4.087990811651480150e-01], 
-[1.917910261672488683e-03, 9.244897959183673297e-01, 4.202989032305157191e-01], 
-[1.917910261672488683e-03, 9.265306122448979664e-01, 4.324270695883307702e-01], 
-[1.917910261672488683e-03, 9.285714285714286031e-01, 4.452367376042778435e-01], 
-[1.917910261672488683e-03, 9.306122448979592399e-01, 4.587872569938339362e-01], 
-[1.917910261672488683e-03, 9.326530612244897656e-01, 4.731451005942165500e-01], 
-[1.917910261672488683e-03, 9.346938775510204023e-01, 4.883849684833723170e-01], 
-[1.917910261672488683e-03, 9.367346938775510390e-01, 5.045911043600622703e-01], 
-[1.917910261672488683e-03, 9.387755102040816757e-01, 5.218588734222409098e-01], 
-[1.917910261672488683e-03, 9.408163265306123124e-01, 5.402966644927276185e-01], 
-[1.917910261672488683e-03, 9.428571428571428381e-01, 5.600281969756142342e-01], 
-[1.917910261672488683e-03, 9.448979591836734748e-01, 5.811953369778970480e-01], 
-[1.917910261672488683e-03, 9.469387755102041115e-01, 6.039615588642450739e-01], 
-[1.917910261672488683e-03, 9.489795918367347483e-01, 6.285162318872140608e-01], 
-[1.917910261672488683e-03, 9.510204081632652739e-01, 6.550799710967367684e-01], 
-[1.917910261672488683e-03, 9.530612244897959107e-01, 6.839113744881319956e-01], 
-[1.917910261672488683e-03, 9.551020408163265474e-01, 7.153155847925687372e-01], 
-[1.917910261672488683e-03, 9.571428571428571841e-01, 7.496552804188217900e-01], 
-[1.917910261672488683e-03, 9.591836734693878208e-01, 7.873649405373125409e-01], 
-[1.917910261672488683e-03, 9.612244897959183465e-01, 8.289695831243774071e-01], 
-[1.917910261672488683e-03, 9.632653061224489832e-01, 8.751097046344589181e-01], 
-[1.917910261672488683e-03, 9.653061224489796199e-01, 9.265749589007139519e-01], 
-[1.917910261672488683e-03, 9.673469387755102566e-01, 9.843503744827800661e-01], 
-[1.917910261672488683e-03, 9.693877551020407823e-01, 1.049680924330481213e+00], 
-[1.917910261672488683e-03, 9.714285714285714191e-01, 1.124163564579995889e+00], 
-[1.917910261672488683e-03, 9.734693877551020558e-01, 1.209881436647773256e+00], 
-[1.917910261672488683e-03, 9.755102040816326925e-01, 1.309604664328012813e+00], 
-[1.917910261672488683e-03, 9.775510204081632182e-01, 1.427099837865369647e+00], 
-[1.917910261672488683e-03, 9.795918367346938549e-01, 1.567623740893694384e+00], 
-[1.917910261672488683e-03, 9.816326530612244916e-01, 1.738743607924767121e+00], 
-[1.917910261672488683e-03, 9.836734693877551283e-01, 1.951767550675770568e+00], 
-[1.917910261672488683e-03, 9.857142857142857650e-01, 2.224390733934300535e+00], 
-[1.917910261672488683e-03, 9.877551020408162907e-01, 2.585964542522113163e+00], 
-[1.917910261672488683e-03, 9.897959183673469274e-01, 3.089030464132578757e+00], 
-[1.917910261672488683e-03, 9.918367346938775642e-01, 3.837983965382225193e+00], 
-[1.917910261672488683e-03, 9.938775510204082009e-01, 5.074440957132199337e+00], 
-[1.917910261672488683e-03, 9.959183673469387266e-01, 7.515429503733751737e+00], 
-[1.917910261672488683e-03, 9.979591836734693633e-01, 1.468523180093753666e+01], 
-[1.917910261672488683e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[2.104904144512019862e-03, 1.000000000000000021e-03, 1.981383108737052451e-02], 
-[2.104904144512019862e-03, 1.148922311909569708e-03, 1.980402001515699228e-02], 
-[2.104904144512019862e-03, 1.320022478803632065e-03, 1.979463106533802322e-02], 
-[2.104904144512019862e-03, 1.516603278119670137e-03, 1.978572747445215760e-02], 
-[2.104904144512019862e-03, 1.742459344546885402e-03, 1.977738206658487957e-02], 
-[2.104904144512019862e-03, 2.001950418545241171e-03, 1.976967874330338992e-02], 
-[2.104904144512019862e-03, 2.300085503203331758e-03, 1.976271421648564952e-02], 
-[2.104904144512019862e-03, 2.642619553930058204e-03, 1.975660002750880689e-02], 
-[2.104904144512019862e-03, 3.036164567398761706e-03, 1.975146490424199708e-02], 
-[2.104904144512019862e-03, 3.488317214113704091e-03, 1.974745751895311957e-02], 
-[2.104904144512019862e-03, 4.007805478313466660e-03, 1.974474972304337411e-02], 
-[2.104904144512019862e-03, 4.604657135827751671e-03, 1.974354035157583481e-02], 
-[2.104904144512019862e-03, 5.290393322046124149e-03, 1.974405971165660301e-02], 
-[2.104904144512019862e-03, 6.078250926476181683e-03, 1.974657489543844152e-02], 
-[2.104904144512019862e-03, 6.983438106813499684e-03, 1.975139609279022435e-02], 
-[2.104904144512019862e-03, 8.023427854757562983e-03, 1.975888412206080330e-02], 
-[2.104904144512019862e-03, 9.218295280327699903e-03, 1.976945945413734196e-02], 
-[2.104904144512019862e-03, 1.059110512533918171e-02, 1.978361307795913071e-02], 
-[2.104904144512019862e-03, 1.216835698628199354e-02, 1.980191965145286850e-02], 
-[2.104904144512019862e-03, 1.398049684082008047e-02, 1.982505350773874908e-02], 
-[2.104904144512019862e-03, 1.606250475199945058e-02, 1.985380825324791626e-02], 
-[2.104904144512019862e-03, 1.845457009472566828e-02, 1.988912091693658193e-02], 
-[2.104904144512019862e-03, 2.120286733852943389e-02, 1.993210190892209799e-02], 
-[2.104904144512019862e-03, 2.436044736169515681e-02, 1.998407245229973789e-02], 
-[2.104904144512019862e-03, 2.798826150195019707e-02, 2.004661170567161380e-02], 
-[2.104904144512019862e-03, 3.215633811115024138e-02, 2.012161655782607889e-02], 
-[2.104904144512019862e-03, 3.694513432520856594e-02, 2.021137813934610616e-02], 
-[2.104904144512019862e-03, 4.244708914272822542e-02, 2.031868059244516106e-02], 
-[2.104904144512019862e-03, 4.876840779169493850e-02, 2.044692977066786890e-02], 
-[2.104904144512019862e-03, 5.603111182818285713e-02, 2.060032261146520216e-02], 
-[2.104904144512019862e-03, 6.437539454049952259e-02, 2.078407241489357155e-02], 
-[2.104904144512019862e-03, 7.396232712556144451e-02, 2.100471192807772114e-02], 
-[2.104904144512019862e-03, 8.497696787531199003e-02, 2.127050620239229195e-02], 
-[2.104904144512019862e-03, 9.763193439036874088e-02, 2.159202268416397438e-02], 
-[2.104904144512019862e-03, 1.121715077759858903e-01, 2.198293035369802695e-02], 
-[2.104904144512019862e-03, 1.288763480443681220e-01, 2.246113892301001419e-02], 
-[2.104904144512019862e-03, 1.480689117455977755e-01, 2.305045388111846838e-02], 
-[2.104904144512019862e-03, 1.701196764046864207e-01, 2.378303349476028339e-02], 
-[2.104904144512019862e-03, 1.954542919161802172e-01, 2.470312826689553820e-02], 
-[2.104904144512019862e-03, 2.245617969409859638e-01, 2.587293955993524158e-02], 
-[2.104904144512019862e-03, 2.580040589080049296e-01, 2.738211700387267050e-02], 
-[2.104904144512019862e-03, 2.964266198426381838e-01, 2.936379481139840542e-02], 
-[2.104904144512019862e-03, 3.405711573811430193e-01, 3.202303898105895996e-02], 
-[2.104904144512019862e-03, 3.912898015080607528e-01, 3.569048052815740335e-02], 
-[2.104904144512019862e-03, 4.495615833752782953e-01, 4.093152648984325209e-02], 
-[2.104904144512019862e-03, 5.165113337172515529e-01, 4.879222670088155522e-02], 
-[2.104904144512019862e-03, 5.934313956619206021e-01, 6.143393859997606926e-02], 
-[2.104904144512019862e-03, 6.818065710636164178e-01, 8.413291729214442127e-02], 
-[2.104904144512019862e-03, 7.833427819015473803e-01, 1.340076420790528022e-01], 
-[2.104904144512019862e-03, 9.000000000000000222e-01, 3.163379172680929052e-01], 
-[2.104904144512019862e-03, 9.020408163265306589e-01, 3.233398587124693968e-01], 
-[2.104904144512019862e-03, 9.040816326530612956e-01, 3.306353619772848806e-01], 
-[2.104904144512019862e-03, 9.061224489795918213e-01, 3.382433210695953707e-01], 
-[2.104904144512019862e-03, 9.081632653061224580e-01, 3.461842929136475511e-01], 
-[2.104904144512019862e-03, 9.102040816326530948e-01, 3.544806848188153392e-01], 
-[2.104904144512019862e-03, 9.122448979591837315e-01, 3.631569679312607879e-01], 
-[2.104904144512019862e-03, 9.142857142857142572e-01, 3.722399209749199800e-01], 
-[2.104904144512019862e-03, 9.163265306122448939e-01, 3.817589094232027858e-01], 
-[2.104904144512019862e-03, 9.183673469387755306e-01, 3.917462062658589872e-01], 
-[2.104904144512019862e-03, 9.204081632653061673e-01, 4.022373617934255075e-01], 
-[2.104904144512019862e-03, 9.224489795918368040e-01, 4.132716313762574978e-01], 
-[2.104904144512019862e-03, 9.244897959183673297e-01, 4.248924721461360687e-01], 
-[2.104904144512019862e-03, 9.265306122448979664e-01, 4.371481218998848894e-01], 
-[2.104904144512019862e-03, 9.285714285714286031e-01, 4.500922765730849817e-01], 
-[2.104904144512019862e-03, 9.306122448979592399e-01, 4.637848864586773256e-01], 
-[2.104904144512019862e-03, 9.326530612244897656e-01, 4.782930962105287898e-01], 
-[2.104904144512019862e-03, 9.346938775510204023e-01, 4.936923598993984141e-01], 
-[2.104904144512019862e-03, 9.367346938775510390e-01, 5.100677704154614744e-01], 
-[2.104904144512019862e-03, 9.387755102040816757e-01, 5.275156529349009915e-01], 
-[2.104904144512019862e-03, 9.408163265306123124e-01, 5.461454858108237831e-01], 
-[2.104904144512019862e-03, 9.428571428571428381e-01, 5.660822302558405905e-01], 
-[2.104904144512019862e-03, 9.448979591836734748e-01, 5.874691741642256160e-01], 
-[2.104904144512019862e-03, 9.469387755102041115e-01, 6.104714276631760805e-01], 
-[2.104904144512019862e-03, 9.489795918367347483e-01, 6.352802517749989164e-01], 
-[2.104904144512019862e-03, 9.510204081632652739e-01, 6.621184617065334344e-01], 
-[2.104904144512019862e-03, 9.530612244897959107e-01, 6.912472298322631659e-01], 
-[2.104904144512019862e-03, 9.551020408163265474e-01, 7.229747309985574688e-01], 
-[2.104904144512019862e-03, 9.571428571428571841e-01, 7.576672404708479913e-01], 
-[2.104904144512019862e-03, 9.591836734693878208e-01, 7.957635376244861503e-01], 
-[2.104904144512019862e-03, 9.612244897959183465e-01, 8.377938256795338656e-01], 
-[2.104904144512019862e-03, 9.632653061224489832e-01, 8.844049126692872242e-01], 
-[2.104904144512019862e-03, 9.653061224489796199e-01, 9.363942154425151099e-01], 
-[2.104904144512019862e-03, 9.673469387755102566e-01, 9.947564220636253562e-01], 
-[2.104904144512019862e-03, 9.693877551020407823e-01, 1.060748681654469783e+00], 
-[2.104904144512019862e-03, 9.714285714285714191e-01, 1.135983524786214449e+00], 
-[2.104904144512019862e-03, 9.734693877551020558e-01, 1.222564347277061536e+00], 
-[2.104904144512019862e-03, 9.755102040816326925e-01, 1.323288119004315977e+00], 
-[2.104904144512019862e-03, 9.775510204081632182e-01, 1.441957804503608775e+00], 
-[2.104904144512019862e-03, 9.795918367346938549e-01, 1.583880757433485220e+00], 
-[2.104904144512019862e-03, 9.816326530612244916e-01, 1.756696701398686056e+00], 
-[2.104904144512019862e-03, 9.836734693877551283e-01, 1.971821565197994897e+00], 
-[2.104904144512019862e-03, 9.857142857142857650e-01, 2.247118341611859638e+00], 
-[2.104904144512019862e-03, 9.877551020408162907e-01, 2.612215129059752616e+00], 
-[2.104904144512019862e-03, 9.897959183673469274e-01, 3.120145307406291035e+00], 
-[2.104904144512019862e-03, 9.918367346938775642e-01, 3.876273548837521510e+00], 
-[2.104904144512019862e-03, 9.938775510204082009e-01, 5.124435573132315014e+00], 
-[2.104904144512019862e-03, 9.959183673469387266e-01, 7.588154677947015259e+00], 
-[2.104904144512019862e-03, 9.979591836734693633e-01, 1.482292211462198495e+01], 
-[2.104904144512019862e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[2.310129700083160455e-03, 1.000000000000000021e-03, 2.005911991657243279e-02], 
-[2.310129700083160455e-03, 1.148922311909569708e-03, 2.004903824209862406e-02], 
-[2.310129700083160455e-03, 1.320022478803632065e-03, 2.003938366746316202e-02], 
-[2.310129700083160455e-03, 1.516603278119670137e-03, 2.003022017154056089e-02], 
-[2.310129700083160455e-03, 1.742459344546885402e-03, 2.002162143281775025e-02], 
-[2.310129700083160455e-03, 2.001950418545241171e-03, 2.001367233667434437e-02], 
-[2.310129700083160455e-03, 2.300085503203331758e-03, 2.000647072838548229e-02], 
-[2.310129700083160455e-03, 2.642619553930058204e-03, 2.000012945578387435e-02], 
-[2.310129700083160455e-03, 3.036164567398761706e-03, 1.999477875367067919e-02], 
-[2.310129700083160455e-03, 3.488317214113704091e-03, 1.999056903377137429e-02], 
-[2.310129700083160455e-03, 4.007805478313466660e-03, 1.998767415705056394e-02], 
-[2.310129700083160455e-03, 4.604657135827751671e-03, 1.998629528242241299e-02], 
-[2.310129700083160455e-03, 5.290393322046124149e-03, 1.998666540723335883e-02], 
-[2.310129700083160455e-03, 6.078250926476181683e-03, 1.998905474191911558e-02], 
-[2.310129700083160455e-03, 6.983438106813499684e-03, 1.999377709588743765e-02], 
-[2.310129700083160455e-03, 8.023427854757562983e-03, 2.000119749559957361e-02], 
-[2.310129700083160455e-03, 9.218295280327699903e-03, 2.001174131320684543e-02], 
-[2.310129700083160455e-03, 1.059110512533918171e-02, 2.002590525792901505e-02], 
-[2.310129700083160455e-03, 1.216835698628199354e-02, 2.004427067925475953e-02], 
-[2.310129700083160455e-03, 1.398049684082008047e-02, 2.006751975837631902e-02], 
-[2.310129700083160455e-03, 1.606250475199945058e-02, 2.009645533297482745e-02], 
-[2.310129700083160455e-03, 1.845457009472566828e-02, 2.013202532556659929e-02], 
-[2.310129700083160455e-03, 2.120286733852943389e-02, 2.017535304818711406e-02], 
-[2.310129700083160455e-03, 2.436044736169515681e-02, 2.022777506624673372e-02], 
-[2.310129700083160455e-03, 2.798826150195019707e-02, 2.029088886450070711e-02], 
-[2.310129700083160455e-03, 3.215633811115024138e-02, 2.036661333066959456e-02], 
-[2.310129700083160455e-03, 3.694513432520856594e-02, 2.045726614769578788e-02], 
-[2.310129700083160455e-03, 4.244708914272822542e-02, 2.056566369913429004e-02], 
-[2.310129700083160455e-03, 4.876840779169493850e-02, 2.069525124667070254e-02], 
-[2.310129700083160455e-03, 5.603111182818285713e-02, 2.085027424489199060e-02], 
-[2.310129700083160455e-03, 6.437539454049952259e-02, 2.103600619939997168e-02], 
-[2.310129700083160455e-03, 7.396232712556144451e-02, 2.125905521590410602e-02], 
-[2.310129700083160455e-03, 8.497696787531199003e-02, 2.152778156851060248e-02], 
-[2.310129700083160455e-03, 9.763193439036874088e-02, 2.185287428321166375e-02], 
-[2.310129700083160455e-03, 1.121715077759858903e-01, 2.224815935936871880e-02], 
-[2.310129700083160455e-03, 1.288763480443681220e-01, 2.273175188554605111e-02], 
-[2.310129700083160455e-03, 1.480689117455977755e-01, 2.332772980657634929e-02], 
-[2.310129700083160455e-03, 1.701196764046864207e-01, 2.406861864416542582e-02], 
-[2.310129700083160455e-03, 1.954542919161802172e-01, 2.499917302292348903e-02], 
-[2.310129700083160455e-03, 2.245617969409859638e-01, 2.618230099544194625e-02], 
-[2.310129700083160455e-03, 2.580040589080049296e-01, 2.770866759760097497e-02], 
-[2.310129700083160455e-03, 2.964266198426381838e-01, 2.971290972527753857e-02], 
-[2.310129700083160455e-03, 3.405711573811430193e-01, 3.240239879186031235e-02], 
-[2.310129700083160455e-03, 3.912898015080607528e-01, 3.611146598665480878e-02], 
-[2.310129700083160455e-03, 4.495615833752782953e-01, 4.141181258572880497e-02], 
-[2.310129700083160455e-03, 5.165113337172515529e-01, 4.936106071922459482e-02], 
-[2.310129700083160455e-03, 5.934313956619206021e-01, 6.214429783375754329e-02], 
-[2.310129700083160455e-03, 6.818065710636164178e-01, 8.509515314634441552e-02], 
-[2.310129700083160455e-03, 7.833427819015473803e-01, 1.355157951333615385e-01], 
-[2.310129700083160455e-03, 9.000000000000000222e-01, 3.197900275617868715e-01], 
-[2.310129700083160455e-03, 9.020408163265306589e-01, 3.268655076144813543e-01], 
-[2.310129700083160455e-03, 9.040816326530612956e-01, 3.342375637249909159e-01], 
-[2.310129700083160455e-03, 9.061224489795918213e-01, 3.419252809442234753e-01], 
-[2.310129700083160455e-03, 9.081632653061224580e-01, 3.499494238600319163e-01], 
-[2.310129700083160455e-03, 9.102040816326530948e-01, 3.583326259211362386e-01], 
-[2.310129700083160455e-03, 9.122448979591837315e-01, 3.670996049999675215e-01], 
-[2.310129700083160455e-03, 9.142857142857142572e-01, 3.762774095420227116e-01], 
-[2.310129700083160455e-03, 9.163265306122448939e-01, 3.858957004932140888e-01], 
-[2.310129700083160455e-03, 9.183673469387755306e-01, 3.959870752296663632e-01], 
-[2.310129700083160455e-03, 9.204081632653061673e-01, 4.065874409845412485e-01], 
-[2.310129700083160455e-03, 9.224489795918368040e-01, 4.177364468360832972e-01], 
-[2.310129700083160455e-03, 9.244897959183673297e-01, 4.294779852707005796e-01], 
-[2.310129700083160455e-03, 9.265306122448979664e-01, 4.418607767695894584e-01], 
-[2.310129700083160455e-03, 9.285714285714286031e-01, 4.549390539252253229e-01], 
-[2.310129700083160455e-03, 9.306122448979592399e-01, 4.687733654575516051e-01], 
-[2.310129700083160455e-03, 9.326530612244897656e-01, 4.834315254117208527e-01], 
-[2.310129700083160455e-03, 9.346938775510204023e-01, 4.989897391063448095e-01], 
-[2.310129700083160455e-03, 9.367346938775510390e-01, 5.155339455048424391e-01], 
-[2.310129700083160455e-03, 9.387755102040816757e-01, 5.331614262055598408e-01], 
-[2.310129700083160455e-03, 9.408163265306123124e-01, 5.519827450194519924e-01], 
-[2.310129700083160455e-03, 9.428571428571428381e-01, 5.721241002830017575e-01], 
-[2.310129700083160455e-03, 9.448979591836734748e-01, 5.937301962631296171e-01], 
-[2.310129700083160455e-03, 9.469387755102041115e-01, 6.169677725591367068e-01], 
-[2.310129700083160455e-03, 9.489795918367347483e-01, 6.420299746150014419e-01], 
-[2.310129700083160455e-03, 9.510204081632652739e-01, 6.691418091600211948e-01], 
-[2.310129700083160455e-03, 9.530612244897959107e-01, 6.985670127368456273e-01], 
-[2.310129700083160455e-03, 9.551020408163265474e-01, 7.306167801478098411e-01], 
-[2.310129700083160455e-03, 9.571428571428571841e-01, 7.656609689264842755e-01], 
-[2.310129700083160455e-03, 9.591836734693878208e-01, 8.041426410057304075e-01], 
-[2.310129700083160455e-03, 9.612244897959183465e-01, 8.465971633087366888e-01], 
-[2.310129700083160455e-03, 9.632653061224489832e-01, 8.936776288934065171e-01], 
-[2.310129700083160455e-03, 9.653061224489796199e-01, 9.461891845288700198e-01], 
-[2.310129700083160455e-03, 9.673469387755102566e-01, 1.005136136031479444e+00], 
-[2.310129700083160455e-03, 9.693877551020407823e-01, 1.071787755297352485e+00], 
-[2.310129700083160455e-03, 9.714285714285714191e-01, 1.147772077985992567e+00], 
-[2.310129700083160455e-03, 9.734693877551020558e-01, 1.235212662675414297e+00], 
-[2.310129700083160455e-03, 9.755102040816326925e-01, 1.336933201780121205e+00], 
-[2.310129700083160455e-03, 9.775510204081632182e-01, 1.456772863680741770e+00], 
-[2.310129700083160455e-03, 9.795918367346938549e-01, 1.600089330469963489e+00], 
-[2.310129700083160455e-03, 9.816326530612244916e-01, 1.774594461253265143e+00], 
-[2.310129700083160455e-03, 9.836734693877551283e-01, 1.991811463963705453e+00], 
-[2.310129700083160455e-03, 9.857142857142857650e-01, 2.269770300966231336e+00], 
-[2.310129700083160455e-03, 9.877551020408162907e-01, 2.638374329351423242e+00], 
-[2.310129700083160455e-03, 9.897959183673469274e-01, 3.151146152856218574e+00], 
-[2.310129700083160455e-03, 9.918367346938775642e-01, 3.914414197984898980e+00], 
-[2.310129700083160455e-03, 9.938775510204082009e-01, 5.174220952164686693e+00], 
-[2.310129700083160455e-03, 9.959183673469387266e-01, 7.660544586125356048e+00], 
-[2.310129700083160455e-03, 9.979591836734693633e-01, 1.495987442647950516e+01], 
-[2.310129700083160455e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[2.535364493970111363e-03, 1.000000000000000021e-03, 2.030475444997008674e-02], 
-[2.535364493970111363e-03, 1.148922311909569708e-03, 2.029439838001386581e-02], 
-[2.535364493970111363e-03, 1.320022478803632065e-03, 2.028447438859263055e-02], 
-[2.535364493970111363e-03, 1.516603278119670137e-03, 2.027504719702986208e-02], 
-[2.535364493970111363e-03, 1.742459344546885402e-03, 2.026619133833309702e-02], 
-[2.535364493970111363e-03, 2.001950418545241171e-03, 2.025799268181940199e-02], 
-[2.535364493970111363e-03, 2.300085503203331758e-03, 2.025055020629036931e-02], 
-[2.535364493970111363e-03, 2.642619553930058204e-03, 2.024397806616779968e-02], 
-[2.535364493970111363e-03, 3.036164567398761706e-03, 2.023840800331992359e-02], 
-[2.535364493970111363e-03, 3.488317214113704091e-03, 2.023399216906433817e-02], 
-[2.535364493970111363e-03, 4.007805478313466660e-03, 2.023090643406010719e-02], 
-[2.535364493970111363e-03, 4.604657135827751671e-03, 2.022935428119589790e-02], 
-[2.535364493970111363e-03, 5.290393322046124149e-03, 2.022957139816920075e-02], 
-[2.535364493970111363e-03, 6.078250926476181683e-03, 2.023183111378964311e-02], 
-[2.535364493970111363e-03, 6.983438106813499684e-03, 2.023645085706697253e-02], 
-[2.535364493970111363e-03, 8.023427854757562983e-03, 2.024379986259838143e-02], 
-[2.535364493970111363e-03, 9.218295280327699903e-03, 2.025430840376928054e-02], 
-[2.535364493970111363e-03, 1.059110512533918171e-02, 2.026847890997751644e-02], 
-[2.535364493970111363e-03, 1.216835698628199354e-02, 2.028689942207489993e-02], 
-[2.535364493970111363e-03, 1.398049684082008047e-02, 2.031025996899903791e-02], 
-[2.535364493970111363e-03, 1.606250475199945058e-02, 2.033937261918492001e-02], 
-[2.535364493970111363e-03, 1.845457009472566828e-02, 2.037519618798876164e-02], 
-[2.535364493970111363e-03, 2.120286733852943389e-02, 2.041886688834608499e-02], 
-[2.535364493970111363e-03, 2.436044736169515681e-02, 2.047173662656784007e-02], 
-[2.535364493970111363e-03, 2.798826150195019707e-02, 2.053542121161647596e-02], 
-[2.535364493970111363e-03, 3.215633811115024138e-02, 2.061186152748220590e-02], 
-[2.535364493970111363e-03, 3.694513432520856594e-02, 2.070340180583031542e-02], 
-[2.535364493970111363e-03, 4.244708914272822542e-02, 2.081289066658612019e-02], 
-[2.535364493970111363e-03, 4.876840779169493850e-02, 2.094381277275860279e-02], 
-[2.535364493970111363e-03, 5.603111182818285713e-02, 2.110046208667449436e-02], 
-[2.535364493970111363e-03, 6.437539454049952259e-02, 2.128817230644534236e-02], 
-[2.535364493970111363e-03, 7.396232712556144451e-02, 2.151362687813693220e-02], 
-[2.535364493970111363e-03, 8.497696787531199003e-02, 2.178528127286288169e-02], 
-[2.535364493970111363e-03, 9.763193439036874088e-02, 2.211394605960094115e-02], 
-[2.535364493970111363e-03, 1.121715077759858903e-01, 2.251360420385907501e-02], 
-[2.535364493970111363e-03, 1.288763480443681220e-01, 2.300257609343997478e-02], 
-[2.535364493970111363e-03, 1.480689117455977755e-01, 2.360521201438536831e-02], 
-[2.535364493970111363e-03, 1.701196764046864207e-01, 2.435440457068985265e-02], 
-[2.535364493970111363e-03, 1.954542919161802172e-01, 2.529541224353833856e-02], 
-[2.535364493970111363e-03, 2.245617969409859638e-01, 2.649184935990082576e-02], 
-[2.535364493970111363e-03, 2.580040589080049296e-01, 2.803539569243724758e-02], 
-[2.535364493970111363e-03, 2.964266198426381838e-01, 3.006218970985819958e-02], 
-[2.535364493970111363e-03, 3.405711573811430193e-01, 3.278190632678218419e-02], 
-[2.535364493970111363e-03, 3.912898015080607528e-01, 3.653257344753611802e-02], 
-[2.535364493970111363e-03, 4.495615833752782953e-01, 4.189217993603333579e-02], 
-[2.535364493970111363e-03, 5.165113337172515529e-01, 4.992990632003525137e-02], 
-[2.535364493970111363e-03, 5.934313956619206021e-01, 6.285453739524073102e-02], 
-[2.535364493970111363e-03, 6.818065710636164178e-01, 8.605698475777270873e-02], 
-[2.535364493970111363e-03, 7.833427819015473803e-01, 1.370227558952849534e-01], 
-[2.535364493970111363e-03, 9.000000000000000222e-01, 3.232369618066329719e-01], 
-[2.535364493970111363e-03, 9.020408163265306589e-01, 3.303858041162262005e-01], 
-[2.535364493970111363e-03, 9.040816326530612956e-01, 3.378342278974347801e-01], 
-[2.535364493970111363e-03, 9.061224489795918213e-01, 3.456015086171671524e-01], 
-[2.535364493970111363e-03, 9.081632653061224580e-01, 3.537086178398862746e-01], 
-[2.535364493970111363e-03, 9.102040816326530948e-01, 3.621784144005058548e-01], 
-[2.535364493970111363e-03, 9.122448979591837315e-01, 3.710358620703867460e-01], 
-[2.535364493970111363e-03, 9.142857142857142572e-01, 3.803082781058487738e-01], 
-[2.535364493970111363e-03, 9.163265306122448939e-01, 3.900256179205616736e-01], 
-[2.535364493970111363e-03, 9.183673469387755306e-01, 4.002208021660217940e-01], 
-[2.535364493970111363e-03, 9.204081632653061673e-01, 4.109300937865538739e-01], 
-[2.535364493970111363e-03, 9.224489795918368040e-01, 4.221935341998540037e-01], 
-[2.535364493970111363e-03, 9.244897959183673297e-01, 4.340554497222608443e-01], 
-[2.535364493970111363e-03, 9.265306122448979664e-01, 4.465650418157852686e-01], 
-[2.535364493970111363e-03, 9.285714285714286031e-01, 4.597770778207726505e-01], 
-[2.535364493970111363e-03, 9.306122448979592399e-01, 4.737527027382270606e-01], 
-[2.535364493970111363e-03, 9.326530612244897656e-01, 4.885603975843749724e-01], 
-[2.535364493970111363e-03, 9.346938775510204023e-01, 5.042771161866160812e-01], 
-[2.535364493970111363e-03, 9.367346938775510390e-01, 5.209896404702130113e-01], 
-[2.535364493970111363e-03, 9.387755102040816757e-01, 5.387962049074216386e-01], 
-[2.535364493970111363e-03, 9.408163265306123124e-01, 5.578084547036499252e-01], 
-[2.535364493970111363e-03, 9.428571428571428381e-01, 5.781538206451410922e-01], 
-[2.535364493970111363e-03, 9.448979591836734748e-01, 5.999784179691445285e-01], 
-[2.535364493970111363e-03, 9.469387755102041115e-01, 6.234506094711307345e-01], 
-[2.535364493970111363e-03, 9.489795918367347483e-01, 6.487654176858066446e-01], 
-[2.535364493970111363e-03, 9.510204081632652739e-01, 6.761500322508733340e-01], 
-[2.535364493970111363e-03, 9.530612244897959107e-01, 7.058707436905892196e-01], 
-[2.535364493970111363e-03, 9.551020408163265474e-01, 7.382417546335156011e-01], 
-[2.535364493970111363e-03, 9.571428571428571841e-01, 7.736364903287287209e-01], 
-[2.535364493970111363e-03, 9.591836734693878208e-01, 8.125022776632102595e-01], 
-[2.535364493970111363e-03, 9.612244897959183465e-01, 8.553796257772183775e-01], 
-[2.535364493970111363e-03, 9.632653061224489832e-01, 9.029278862672843742e-01], 
-[2.535364493970111363e-03, 9.653061224489796199e-01, 9.559599028140757238e-01], 
-[2.535364493970111363e-03, 9.673469387755102566e-01, 1.015489557343894234e+00], 
-[2.535364493970111363e-03, 9.693877551020407823e-01, 1.082798191273536048e+00], 
-[2.535364493970111363e-03, 9.714285714285714191e-01, 1.159529276194768643e+00], 
-[2.535364493970111363e-03, 9.734693877551020558e-01, 1.247826442060018692e+00], 
-[2.535364493970111363e-03, 9.755102040816326925e-01, 1.350539980627778025e+00], 
-[2.535364493970111363e-03, 9.775510204081632182e-01, 1.471545094174355528e+00], 
-[2.535364493970111363e-03, 9.795918367346938549e-01, 1.616249552355538022e+00], 
-[2.535364493970111363e-03, 9.816326530612244916e-01, 1.792436997263216591e+00], 
-[2.535364493970111363e-03, 9.836734693877551283e-01, 2.011737379698942618e+00], 
-[2.535364493970111363e-03, 9.857142857142857650e-01, 2.292346775961249250e+00], 
-[2.535364493970111363e-03, 9.877551020408162907e-01, 2.664442351700726519e+00], 
-[2.535364493970111363e-03, 9.897959183673469274e-01, 3.182033275361083824e+00], 
-[2.535364493970111363e-03, 9.918367346938775642e-01, 3.952406295902761713e+00], 
-[2.535364493970111363e-03, 9.938775510204082009e-01, 5.223797675682658515e+00], 
-[2.535364493970111363e-03, 9.959183673469387266e-01, 7.732600257463726479e+00], 
-[2.535364493970111363e-03, 9.979591836734693633e-01, 1.509609136895124415e+01], 
-[2.535364493970111363e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[2.782559402207125665e-03, 1.000000000000000021e-03, 2.055073493024603404e-02], 
-[2.782559402207125665e-03, 1.148922311909569708e-03, 2.054010066486364194e-02], 
-[2.782559402207125665e-03, 1.320022478803632065e-03, 2.052990345795729227e-02], 
-[2.782559402207125665e-03, 1.516603278119670137e-03, 2.052020877341106594e-02], 
-[2.782559402207125665e-03, 1.742459344546885402e-03, 2.051109199887095683e-02], 
-[2.782559402207125665e-03, 2.001950418545241171e-03, 2.050263998771485047e-02], 
-[2.782559402207125665e-03, 2.300085503203331758e-03, 2.049495285239828768e-02], 
-[2.782559402207125665e-03, 2.642619553930058204e-03, 2.048814605406358569e-02], 
-[2.782559402207125665e-03, 3.036164567398761706e-03, 2.048235284177865601e-02], 
-[2.782559402207125665e-03, 3.488317214113704091e-03, 2.047772710658502665e-02], 
-[2.782559402207125665e-03, 4.007805478313466660e-03, 2.047444672896398671e-02], 
-[2.782559402207125665e-03, 4.604657135827751671e-03, 2.047271751589855790e-02], 
-[2.782559402207125665e-03, 5.290393322046124149e-03, 2.047277784554376451e-02], 
-[2.782559402207125665e-03, 6.078250926476181683e-03, 2.047490416516922068e-02], 
-[2.782559402207125665e-03, 6.983438106813499684e-03, 2.047941752344414196e-02], 
-[2.782559402207125665e-03, 8.023427854757562983e-03, 2.048669136311876901e-02], 
-[2.782559402207125665e-03, 9.218295280327699903e-03, 2.049716085877496471e-02], 
-[2.782559402207125665e-03, 1.059110512533918171e-02, 2.051133415987751660e-02], 
-[2.782559402207125665e-03, 1.216835698628199354e-02, 2.052980599843242868e-02], 
-[2.782559402207125665e-03, 1.398049684082008047e-02, 2.055327425078409126e-02], 
-[2.782559402207125665e-03, 1.606250475199945058e-02, 2.058256021561145552e-02], 
-[2.782559402207125665e-03, 1.845457009472566828e-02, 2.061863360037407417e-02], 
-[2.782559402207125665e-03, 2.120286733852943389e-02, 2.066264351787037296e-02], 
-[2.782559402207125665e-03, 2.436044736169515681e-02, 2.071595721387487626e-02], 
-[2.782559402207125665e-03, 2.798826150195019707e-02, 2.078020881958454746e-02], 
-[2.782559402207125665e-03, 3.215633811115024138e-02, 2.085736121256487677e-02], 
-[2.782559402207125665e-03, 3.694513432520856594e-02, 2.094978516952956948e-02], 
-[2.782559402207125665e-03, 4.244708914272822542e-02, 2.106036154175728453e-02], 
-[2.782559402207125665e-03, 4.876840779169493850e-02, 2.119261438670768521e-02], 
-[2.782559402207125665e-03, 5.603111182818285713e-02, 2.135088616498397734e-02], 
-[2.782559402207125665e-03, 6.437539454049952259e-02, 2.154057075408986194e-02], 
-[2.782559402207125665e-03, 7.396232712556144451e-02, 2.176842692211827107e-02], 
-[2.782559402207125665e-03, 8.497696787531199003e-02, 2.204300531134107538e-02], 
-[2.782559402207125665e-03, 9.763193439036874088e-02, 2.237523799688567738e-02], 
-[2.782559402207125665e-03, 1.121715077759858903e-01, 2.277926485730054351e-02], 
-[2.782559402207125665e-03, 1.288763480443681220e-01, 2.327361150206715829e-02], 
-[2.782559402207125665e-03, 1.480689117455977755e-01, 2.388290044351186123e-02], 
-[2.782559402207125665e-03, 1.701196764046864207e-01, 2.464039119482482054e-02], 
-[2.782559402207125665e-03, 1.954542919161802172e-01, 2.559184582815100112e-02], 
-[2.782559402207125665e-03, 2.245617969409859638e-01, 2.680158452832614654e-02], 
-[2.782559402207125665e-03, 2.580040589080049296e-01, 2.836230113473730066e-02], 
-[2.782559402207125665e-03, 2.964266198426381838e-01, 3.041163457731102179e-02], 
-[2.782559402207125665e-03, 3.405711573811430193e-01, 3.316156135659304588e-02], 
-[2.782559402207125665e-03, 3.912898015080607528e-01, 3.695380263073609617e-02], 
-[2.782559402207125665e-03, 4.495615833752782953e-01, 4.237262819773766898e-02], 
-[2.782559402207125665e-03, 5.165113337172515529e-01, 5.049876308288147458e-02], 
-[2.782559402207125665e-03, 5.934313956619206021e-01, 6.356465677465050756e-02], 
-[2.782559402207125665e-03, 6.818065710636164178e-01, 8.701841154738404471e-02], 
-[2.782559402207125665e-03, 7.833427819015473803e-01, 1.385285239746977537e-01], 
-[2.782559402207125665e-03, 9.000000000000000222e-01, 3.266787232677106356e-01], 
-[2.782559402207125665e-03, 9.020408163265306589e-01, 3.339007516982940849e-01], 
-[2.782559402207125665e-03, 9.040816326530612956e-01, 3.414253582048797364e-01], 
-[2.782559402207125665e-03, 9.061224489795918213e-01, 3.492720080436976793e-01], 
-[2.782559402207125665e-03, 9.081632653061224580e-01, 3.574618790701220572e-01], 
-[2.782559402207125665e-03, 9.102040816326530948e-01, 3.660180547535407669e-01], 
-[2.782559402207125665e-03, 9.122448979591837315e-01, 3.749657439384957991e-01], 
-[2.782559402207125665e-03, 9.142857142857142572e-01, 3.843325317831586263e-01], 
-[2.782559402207125665e-03, 9.163265306122448939e-01, 3.941486671661808550e-01], 
-[2.782559402207125665e-03, 9.183673469387755306e-01, 4.044473929056243700e-01], 
-[2.782559402207125665e-03, 9.204081632653061673e-01, 4.152653264279754231e-01], 
-[2.782559402207125665e-03, 9.224489795918368040e-01, 4.266429001247052932e-01], 
-[2.782559402207125665e-03, 9.244897959183673297e-01, 4.386248726204953208e-01], 
-[2.782559402207125665e-03, 9.265306122448979664e-01, 4.512609246581206768e-01], 
-[2.782559402207125665e-03, 9.285714285714286031e-01, 4.646063564207447705e-01], 
-[2.782559402207125665e-03, 9.306122448979592399e-01, 4.787229070490046090e-01], 
-[2.782559402207125665e-03, 9.326530612244897656e-01, 4.936797221151323911e-01], 
-[2.782559402207125665e-03, 9.346938775510204023e-01, 5.095545012221393000e-01], 
-[2.782559402207125665e-03, 9.367346938775510390e-01, 5.264348661524923534e-01], 
-[2.782559402207125665e-03, 9.387755102040816757e-01, 5.444200007119015527e-01], 
-[2.782559402207125665e-03, 9.408163265306123124e-01, 5.636226274458702168e-01], 
-[2.782559402207125665e-03, 9.428571428571428381e-01, 5.841714049268005304e-01], 
-[2.782559402207125665e-03, 9.448979591836734748e-01, 6.062138539722565778e-01], 
-[2.782559402207125665e-03, 9.469387755102041115e-01, 6.299199543124067713e-01], 
-[2.782559402207125665e-03, 9.489795918367347483e-01, 6.554865982588512496e-01], 
-[2.782559402207125665e-03, 9.510204081632652739e-01, 6.831431497640056971e-01], 
-[2.782559402207125665e-03, 9.530612244897959107e-01, 7.131584431715757288e-01], 
-[2.782559402207125665e-03, 9.551020408163265474e-01, 7.458496768360571849e-01], 
-[2.782559402207125665e-03, 9.571428571428571841e-01, 7.815938292052202474e-01], 
-[2.782559402207125665e-03, 9.591836734693878208e-01, 8.208424745607321160e-01], 
-[2.782559402207125665e-03, 9.612244897959183465e-01, 8.641412428283042901e-01], 
-[2.782559402207125665e-03, 9.632653061224489832e-01, 9.121557177252539450e-01], 
-[2.782559402207125665e-03, 9.653061224489796199e-01, 9.657064069212304425e-01], 
-[2.782559402207125665e-03, 9.673469387755102566e-01, 1.025816726921107147e+00], 
-[2.782559402207125665e-03, 9.693877551020407823e-01, 1.093780035552649688e+00], 
-[2.782559402207125665e-03, 9.714285714285714191e-01, 1.171255171374006920e+00], 
-[2.782559402207125665e-03, 9.734693877551020558e-01, 1.260405744582642651e+00], 
-[2.782559402207125665e-03, 9.755102040816326925e-01, 1.364108523439748533e+00], 
-[2.782559402207125665e-03, 9.775510204081632182e-01, 1.486274574663564607e+00], 
-[2.782559402207125665e-03, 9.795918367346938549e-01, 1.632361515319819878e+00], 
-[2.782559402207125665e-03, 9.816326530612244916e-01, 1.810224419047878897e+00], 
-[2.782559402207125665e-03, 9.836734693877551283e-01, 2.031599444929489628e+00], 
-[2.782559402207125665e-03, 9.857142857142857650e-01, 2.314847930296323852e+00], 
-[2.782559402207125665e-03, 9.877551020408162907e-01, 2.690419404051288765e+00], 
-[2.782559402207125665e-03, 9.897959183673469274e-01, 3.212806949287749791e+00], 
-[2.782559402207125665e-03, 9.918367346938775642e-01, 3.990250224894932529e+00], 
-[2.782559402207125665e-03, 9.938775510204082009e-01, 5.273166323847071624e+00], 
-[2.782559402207125665e-03, 9.959183673469387266e-01, 7.804322718585658514e+00], 
-[2.782559402207125665e-03, 9.979591836734693633e-01, 1.523157556669482915e+01], 
-[2.782559402207125665e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[3.053855508833415357e-03, 1.000000000000000021e-03, 2.079706160015408825e-02], 
-[3.053855508833415357e-03, 1.148922311909569708e-03, 2.078614533267614597e-02], 
-[3.053855508833415357e-03, 1.320022478803632065e-03, 2.077567110485110252e-02], 
-[3.053855508833415357e-03, 1.516603278119670137e-03, 2.076570512323419604e-02], 
-[3.053855508833415357e-03, 1.742459344546885402e-03, 2.075632363022624285e-02], 
-[3.053855508833415357e-03, 2.001950418545241171e-03, 2.074761446338778403e-02], 
-[3.053855508833415357e-03, 2.300085503203331758e-03, 2.073967886895393409e-02], 
-[3.053855508833415357e-03, 2.642619553930058204e-03, 2.073263361491685733e-02], 
-[3.053855508833415357e-03, 3.036164567398761706e-03, 2.072661345767432689e-02], 
-[3.053855508833415357e-03, 3.488317214113704091e-03, 2.072177402812080960e-02], 
-[3.053855508833415357e-03, 4.007805478313466660e-03, 2.071829521668451524e-02], 
-[3.053855508833415357e-03, 4.604657135827751671e-03, 2.071638515455890422e-02], 
-[3.053855508833415357e-03, 5.290393322046124149e-03, 2.071628491045879317e-02], 
-[3.053855508833415357e-03, 6.078250926476181683e-03, 2.071827405019506518e-02], 
-[3.053855508833415357e-03, 6.983438106813499684e-03, 2.072267724214822693e-02], 
-[3.053855508833415357e-03, 8.023427854757562983e-03, 2.072987213723216648e-02], 
-[3.053855508833415357e-03, 9.218295280327699903e-03, 2.074029881118003363e-02], 
-[3.053855508833415357e-03, 1.059110512533918171e-02, 2.075447113340370131e-02], 
-[3.053855508833415357e-03, 1.216835698628199354e-02, 2.077299052684426078e-02], 
-[3.053855508833415357e-03, 1.398049684082008047e-02, 2.079656271490243694e-02], 
-[3.053855508833415357e-03, 1.606250475199945058e-02, 2.082601822597739821e-02], 
-[3.053855508833415357e-03, 1.845457009472566828e-02, 2.086233765887926875e-02], 
-[3.053855508833415357e-03, 2.120286733852943389e-02, 2.090668302521318800e-02], 
-[3.053855508833415357e-03, 2.436044736169515681e-02, 2.096043690875759591e-02], 
-[3.053855508833415357e-03, 2.798826150195019707e-02, 2.102525176094464932e-02], 
-[3.053855508833415357e-03, 3.215633811115024138e-02, 2.110311245018898357e-02], 
-[3.053855508833415357e-03, 3.694513432520856594e-02, 2.119641629454019002e-02], 
-[3.053855508833415357e-03, 4.244708914272822542e-02, 2.130807637156767465e-02], 
-[3.053855508833415357e-03, 4.876840779169493850e-02, 2.144165612625398287e-02], 
-[3.053855508833415357e-03, 5.603111182818285713e-02, 2.160154650794848807e-02], 
-[3.053855508833415357e-03, 6.437539454049952259e-02, 2.179320156034767614e-02], 
-[3.053855508833415357e-03, 7.396232712556144451e-02, 2.202345535514164260e-02], 
-[3.053855508833415357e-03, 8.497696787531199003e-02, 2.230095367978658649e-02], 
-[3.053855508833415357e-03, 9.763193439036874088e-02, 2.263675007856780913e-02], 
-[3.053855508833415357e-03, 1.121715077759858903e-01, 2.304514128977361645e-02], 
-[3.053855508833415357e-03, 1.288763480443681220e-01, 2.354485806675103710e-02], 
-[3.053855508833415357e-03, 1.480689117455977755e-01, 2.416079503287225927e-02], 
-[3.053855508833415357e-03, 1.701196764046864207e-01, 2.492657843701584150e-02], 
-[3.053855508833415357e-03, 1.954542919161802172e-01, 2.588847367613363037e-02], 
-[3.053855508833415357e-03, 2.245617969409859638e-01, 2.711150637570450966e-02], 
-[3.053855508833415357e-03, 2.580040589080049296e-01, 2.868938377084631272e-02], 
-[3.053855508833415357e-03, 2.964266198426381838e-01, 3.076124413982180006e-02], 
-[3.053855508833415357e-03, 3.405711573811430193e-01, 3.354136365211569937e-02], 
-[3.053855508833415357e-03, 3.912898015080607528e-01, 3.737515325630423602e-02], 
-[3.053855508833415357e-03, 4.495615833752782953e-01, 4.285315702803271093e-02], 
-[3.053855508833415357e-03, 5.165113337172515529e-01, 5.106763058769780983e-02], 
-[3.053855508833415357e-03, 5.934313956619206021e-01, 6.427465546284982789e-02], 
-[3.053855508833415357e-03, 6.818065710636164178e-01, 8.797943293728109626e-02], 
-[3.053855508833415357e-03, 7.833427819015473803e-01, 1.400330989836733320e-01], 
-[3.053855508833415357e-03, 9.000000000000000222e-01, 3.301153152134762014e-01], 
-[3.053855508833415357e-03, 9.020408163265306589e-01, 3.374103538445958339e-01], 
-[3.053855508833415357e-03, 9.040816326530612956e-01, 3.450109583608420571e-01], 
-[3.053855508833415357e-03, 9.061224489795918213e-01, 3.529367831822595725e-01], 
-[3.053855508833415357e-03, 9.081632653061224580e-01, 3.612092117707301764e-01], 
-[3.053855508833415357e-03, 9.102040816326530948e-01, 3.698515514798285109e-01], 
-[3.053855508833415357e-03, 9.122448979591837315e-01, 3.788892554031175197e-01], 
-[3.053855508833415357e-03, 9.142857142857142572e-01, 3.883501756934146787e-01], 
-[3.053855508833415357e-03, 9.163265306122448939e-01, 3.982648536935428085e-01], 
-[3.053855508833415357e-03, 9.183673469387755306e-01, 4.086668532815196375e-01], 
-[3.053855508833415357e-03, 9.204081632653061673e-01, 4.195931451394480094e-01], 
-[3.053855508833415357e-03, 9.224489795918368040e-01, 4.310845512696565573e-01], 
-[3.053855508833415357e-03, 9.244897959183673297e-01, 4.431862610866846297e-01], 
-[3.053855508833415357e-03, 9.265306122448979664e-01, 4.559484329175259587e-01], 
-[3.053855508833415357e-03, 9.285714285714286031e-01, 4.694268978870774767e-01], 
-[3.053855508833415357e-03, 9.306122448979592399e-01, 4.836839871386878764e-01], 
-[3.053855508833415357e-03, 9.326530612244897656e-01, 4.987895083906661586e-01], 
-[3.053855508833415357e-03, 9.346938775510204023e-01, 5.148219042943353863e-01], 
-[3.053855508833415357e-03, 9.367346938775510390e-01, 5.318696333914806340e-01], 
-[3.053855508833415357e-03, 9.387755102040816757e-01, 5.500328252885978708e-01], 
-[3.053855508833415357e-03, 9.408163265306123124e-01, 5.694252758259474856e-01], 
-[3.053855508833415357e-03, 9.428571428571428381e-01, 5.901768667089895004e-01], 
-[3.053855508833415357e-03, 9.448979591836734748e-01, 6.124365189578693247e-01], 
-[3.053855508833415357e-03, 9.469387755102041115e-01, 6.363758229904219466e-01], 
-[3.053855508833415357e-03, 9.489795918367347483e-01, 6.621935335983892834e-01], 
-[3.053855508833415357e-03, 9.510204081632652739e-01, 6.901211804755391643e-01], 
-[3.053855508833415357e-03, 9.530612244897959107e-01, 7.204301316472223604e-01], 
-[3.053855508833415357e-03, 9.551020408163265474e-01, 7.534405691229741908e-01], 
-[3.053855508833415357e-03, 9.571428571428571841e-01, 7.895330100682040886e-01], 
-[3.053855508833415357e-03, 9.591836734693878208e-01, 8.291632586437056585e-01], 
-[3.053855508833415357e-03, 9.612244897959183465e-01, 8.728820441833731181e-01], 
-[3.053855508833415357e-03, 9.632653061224489832e-01, 9.213611561754790902e-01], 
-[3.053855508833415357e-03, 9.653061224489796199e-01, 9.754287334422004907e-01], 
-[3.053855508833415357e-03, 9.673469387755102566e-01, 1.036117685646004150e+00], 
-[3.053855508833415357e-03, 9.693877551020407823e-01, 1.104733334059520899e+00], 
-[3.053855508833415357e-03, 9.714285714285714191e-01, 1.182949815431186824e+00], 
-[3.053855508833415357e-03, 9.734693877551020558e-01, 1.272950629329626882e+00], 
-[3.053855508833415357e-03, 9.755102040816326925e-01, 1.377638898028601844e+00], 
-[3.053855508833415357e-03, 9.775510204081632182e-01, 1.500961383729026988e+00], 
-[3.053855508833415357e-03, 9.795918367346938549e-01, 1.648425311469669197e+00], 
-[3.053855508833415357e-03, 9.816326530612244916e-01, 1.827956836071296554e+00], 
-[3.053855508833415357e-03, 9.836734693877551283e-01, 2.051397791981006691e+00], 
-[3.053855508833415357e-03, 9.857142857142857650e-01, 2.337273927406815055e+00], 
-[3.053855508833415357e-03, 9.877551020408162907e-01, 2.716305693987113745e+00], 
-[3.053855508833415357e-03, 9.897959183673469274e-01, 3.243467448491837768e+00], 
-[3.053855508833415357e-03, 9.918367346938775642e-01, 4.027946366491786279e+00], 
-[3.053855508833415357e-03, 9.938775510204082009e-01, 5.322327475528489948e+00], 
-[3.053855508833415357e-03, 9.959183673469387266e-01, 7.875712993548259711e+00], 
-[3.053855508833415357e-03, 9.979591836734693633e-01, 1.536632963660416351e+01], 
-[3.053855508833415357e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[3.351602650938840990e-03, 1.000000000000000021e-03, 2.104373470251941214e-02], 
-[3.351602650938840990e-03, 1.148922311909569708e-03, 2.103253261954675032e-02], 
-[3.351602650938840990e-03, 1.320022478803632065e-03, 2.102177755863115713e-02], 
-[3.351602650938840990e-03, 1.516603278119670137e-03, 2.101153646910831549e-02], 
-[3.351602650938840990e-03, 1.742459344546885402e-03, 2.100188644824885209e-02], 
-[3.351602650938840990e-03, 2.001950418545241171e-03, 2.099291631791613821e-02], 
-[3.351602650938840990e-03, 2.300085503203331758e-03, 2.098472845824877336e-02], 
-[3.351602650938840990e-03, 2.642619553930058204e-03, 2.097744094421588601e-02], 
-[3.351602650938840990e-03, 3.036164567398761706e-03, 2.097119003967293227e-02], 
-[3.351602650938840990e-03, 3.488317214113704091e-03, 2.096613311549357789e-02], 
-[3.351602650938840990e-03, 4.007805478313466660e-03, 2.096245207217438400e-02], 
-[3.351602650938840990e-03, 4.604657135827751671e-03, 2.096035736523172571e-02], 
-[3.351602650938840990e-03, 5.290393322046124149e-03, 2.096009275403824812e-02], 
-[3.351602650938840990e-03, 6.078250926476181683e-03, 2.096194092302251788e-02], 
-[3.351602650938840990e-03, 6.983438106813499684e-03, 2.096623016032254233e-02], 
-[3.351602650938840990e-03, 8.023427854757562983e-03, 2.097334232501993009e-02], 
-[3.351602650938840990e-03, 9.218295280327699903e-03, 2.098372239394648286e-02], 
-[3.351602650938840990e-03, 1.059110512533918171e-02, 2.099788995633255356e-02], 
-[3.351602650938840990e-03, 1.216835698628199354e-02, 2.101645312582502839e-02], 
-[3.351602650938840990e-03, 1.398049684082008047e-02, 2.104012547251874268e-02], 
-[3.351602650938840990e-03, 1.606250475199945058e-02, 2.106974675399547400e-02], 
-[3.351602650938840990e-03, 1.845457009472566828e-02, 2.110630845964689417e-02], 
-[3.351602650938840990e-03, 2.120286733852943389e-02, 2.115098549880957413e-02], 
-[3.351602650938840990e-03, 2.436044736169515681e-02, 2.120517579178376327e-02], 
-[3.351602650938840990e-03, 2.798826150195019707e-02, 2.127055010821072428e-02], 
-[3.351602650938840990e-03, 3.215633811115024138e-02, 2.134911530459633264e-02], 
-[3.351602650938840990e-03, 3.694513432520856594e-02, 2.144329523657561437e-02], 
-[3.351602650938840990e-03, 4.244708914272822542e-02, 2.155603520290050312e-02], 
-[3.351602650938840990e-03, 4.876840779169493850e-02, 2.169093802909349833e-02], 
-[3.351602650938840990e-03, 5.603111182818285713e-02, 2.185244314365297064e-02], 
-[3.351602650938840990e-03, 6.437539454049952259e-02, 2.204606474318693971e-02], 
-[3.351602650938840990e-03, 7.396232712556144451e-02, 2.227871218445212631e-02], 
-[3.351602650938840990e-03, 8.497696787531199003e-02, 2.255912637399037912e-02], 
-[3.351602650938840990e-03, 9.763193439036874088e-02, 2.289848228809743952e-02], 
-[3.351602650938840990e-03, 1.121715077759858903e-01, 2.331123347130162685e-02], 
-[3.351602650938840990e-03, 1.288763480443681220e-01, 2.381631574276322355e-02], 
-[3.351602650938840990e-03, 1.480689117455977755e-01, 2.443889572133321753e-02], 
-[3.351602650938840990e-03, 1.701196764046864207e-01, 2.521296621766274879e-02], 
-[3.351602650938840990e-03, 1.954542919161802172e-01, 2.618529568681973729e-02], 
-[3.351602650938840990e-03, 2.245617969409859638e-01, 2.742161477699498612e-02], 
-[3.351602650938840990e-03, 2.580040589080049296e-01, 2.901664344709894636e-02], 
-[3.351602650938840990e-03, 2.964266198426381838e-01, 3.111101820959162254e-02], 
-[3.351602650938840990e-03, 3.405711573811430193e-01, 3.392131298422748631e-02], 
-[3.351602650938840990e-03, 3.912898015080607528e-01, 3.779662504440489679e-02], 
-[3.351602650938840990e-03, 4.495615833752782953e-01, 4.333376608431960264e-02], 
-[3.351602650938840990e-03, 5.165113337172515529e-01, 5.163650841478545361e-02], 
-[3.351602650938840990e-03, 5.934313956619206021e-01, 6.498453295133968521e-02], 
-[3.351602650938840990e-03, 6.818065710636164178e-01, 8.894004835071342430e-02], 
-[3.351602650938840990e-03, 7.833427819015473803e-01, 1.415364805364808798e-01], 
-[3.351602650938840990e-03, 9.000000000000000222e-01, 3.335467409157502061e-01], 
-[3.351602650938840990e-03, 9.020408163265306589e-01, 3.409146140423489069e-01], 
-[3.351602650938840990e-03, 9.040816326530612956e-01, 3.485910320820757580e-01], 
-[3.351602650938840990e-03, 9.061224489795918213e-01, 3.565958379944556556e-01], 
-[3.351602650938840990e-03, 9.081632653061224580e-01, 3.649506201647658710e-01], 
-[3.351602650938840990e-03, 9.102040816326530948e-01, 3.736789090819121473e-01], 
-[3.351602650938840990e-03, 9.122448979591837315e-01, 3.828064012659045945e-01], 
-[3.351602650938840990e-03, 9.142857142857142572e-01, 3.923612149587639153e-01], 
-[3.351602650938840990e-03, 9.163265306122448939e-01, 4.023741829686376947e-01], 
-[3.351602650938840990e-03, 9.183673469387755306e-01, 4.128791891290818361e-01], 
-[3.351602650938840990e-03, 9.204081632653061673e-01, 4.239135561537253905e-01], 
-[3.351602650938840990e-03, 9.224489795918368040e-01, 4.355184942955910854e-01], 
-[3.351602650938840990e-03, 9.244897959183673297e-01, 4.477396222436917927e-01], 
-[3.351602650938840990e-03, 9.265306122448979664e-01, 4.606275742161928810e-01], 
-[3.351602650938840990e-03, 9.285714285714286031e-01, 4.742387103826030681e-01], 
-[3.351602650938840990e-03, 9.306122448979592399e-01, 4.886359517565623811e-01], 
-[3.351602650938840990e-03, 9.326530612244897656e-01, 5.038897657976579847e-01], 
-[3.351602650938840990e-03, 9.346938775510204023e-01, 5.200793354840957949e-01], 
-[3.351602650938840990e-03, 9.367346938775510390e-01, 5.372939530258353802e-01], 
-[3.351602650938840990e-03, 9.387755102040816757e-01, 5.556346903052655772e-01], 
-[3.351602650938840990e-03, 9.408163265306123124e-01, 5.752164124210731311e-01], 
-[3.351602650938840990e-03, 9.428571428571428381e-01, 5.961702195691593875e-01], 
-[3.351602650938840990e-03, 9.448979591836734748e-01, 6.186464276067767942e-01], 
-[3.351602650938840990e-03, 9.469387755102041115e-01, 6.428182314068164871e-01], 
-[3.351602650938840990e-03, 9.489795918367347483e-01, 6.688862409614635407e-01], 
-[3.351602650938840990e-03, 9.510204081632652739e-01, 6.970841431527731169e-01], 
-[3.351602650938840990e-03, 9.530612244897959107e-01, 7.276858295742542060e-01], 
-[3.351602650938840990e-03, 9.551020408163265474e-01, 7.610144538489327370e-01], 
-[3.351602650938840990e-03, 9.571428571428571841e-01, 7.974540574145023708e-01], 
-[3.351602650938840990e-03, 9.591836734693878208e-01, 8.374646568391197476e-01], 
-[3.351602650938840990e-03, 9.612244897959183465e-01, 8.816020595418339045e-01], 
-[3.351602650938840990e-03, 9.632653061224489832e-01, 9.305442344999315107e-01], 
-[3.351602650938840990e-03, 9.653061224489796199e-01, 9.851269189375972957e-01], 
-[3.351602650938840990e-03, 9.673469387755102566e-01, 1.046392474364106873e+00], 
-[3.351602650938840990e-03, 9.693877551020407823e-01, 1.115658132674154812e+00], 
-[3.351602650938840990e-03, 9.714285714285714191e-01, 1.194613260219796302e+00], 
-[3.351602650938840990e-03, 9.734693877551020558e-01, 1.285461155321883542e+00], 
-[3.351602650938840990e-03, 9.755102040816326925e-01, 1.391131172127035853e+00], 
-[3.351602650938840990e-03, 9.775510204081632182e-01, 1.515605599852982266e+00], 
-[3.351602650938840990e-03, 9.795918367346938549e-01, 1.664441032789248487e+00], 
-[3.351602650938840990e-03, 9.816326530612244916e-01, 1.845634357642316203e+00], 
-[3.351602650938840990e-03, 9.836734693877551283e-01, 2.071132552979197516e+00], 
-[3.351602650938840990e-03, 9.857142857142857650e-01, 2.359624930464255144e+00], 
-[3.351602650938840990e-03, 9.877551020408162907e-01, 2.742101428733006330e+00], 
-[3.351602650938840990e-03, 9.897959183673469274e-01, 3.274015046318425437e+00], 
-[3.351602650938840990e-03, 9.918367346938775642e-01, 4.065495101451409354e+00], 
-[3.351602650938840990e-03, 9.938775510204082009e-01, 5.371281708309435743e+00], 
-[3.351602650938840990e-03, 9.959183673469387266e-01, 7.946772103847647983e+00], 
-[3.351602650938840990e-03, 9.979591836734693633e-01, 1.550035618782962921e+01], 
-[3.351602650938840990e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[3.678379771828634275e-03, 1.000000000000000021e-03, 2.129075448023847600e-02], 
-[3.678379771828634275e-03, 1.148922311909569708e-03, 2.127926276163803754e-02], 
-[3.678379771828634275e-03, 1.320022478803632065e-03, 2.126822304871767155e-02], 
-[3.678379771828634275e-03, 1.516603278119670137e-03, 2.125770303370148884e-02], 
-[3.678379771828634275e-03, 1.742459344546885402e-03, 2.124778066884356817e-02], 
-[3.678379771828634275e-03, 2.001950418545241171e-03, 2.123854576042866898e-02], 
-[3.678379771828634275e-03, 2.300085503203331758e-03, 2.123010182262094481e-02], 
-[3.678379771828634275e-03, 2.642619553930058204e-03, 2.122256823749155835e-02], 
-[3.678379771828634275e-03, 3.036164567398761706e-03, 2.121608277647898944e-02], 
-[3.678379771828634275e-03, 3.488317214113704091e-03, 2.121080455055959421e-02], 
-[3.678379771828634275e-03, 4.007805478313466660e-03, 2.120691747041659331e-02], 
-[3.678379771828634275e-03, 4.604657135827751671e-03, 2.120463431599802287e-02], 
-[3.678379771828634275e-03, 5.290393322046124149e-03, 2.120420153742823971e-02], 
-[3.678379771828634275e-03, 6.078250926476181683e-03, 2.120590493782497851e-02], 
-[3.678379771828634275e-03, 6.983438106813499684e-03, 2.121007642512435371e-02], 
-[3.678379771828634275e-03, 8.023427854757562983e-03, 2.121710206657334563e-02], 
-[3.678379771828634275e-03, 9.218295280327699903e-03, 2.122743174004216443e-02], 
-[3.678379771828634275e-03, 1.059110512533918171e-02, 2.124159075444235351e-02], 
-[3.678379771828634275e-03, 1.216835698628199354e-02, 2.126019391388715707e-02], 
-[3.678379771828634275e-03, 1.398049684082008047e-02, 2.128396263479143471e-02], 
-[3.678379771828634275e-03, 1.606250475199945058e-02, 2.131374590337169195e-02], 
-[3.678379771828634275e-03, 1.845457009472566828e-02, 2.135054609880524673e-02], 
-[3.678379771828634275e-03, 2.120286733852943389e-02, 2.139555102707643014e-02], 
-[3.678379771828634275e-03, 2.436044736169515681e-02, 2.145017394349907347e-02], 
-[3.678379771828634275e-03, 2.798826150195019707e-02, 2.151610393387083653e-02], 
-[3.678379771828634275e-03, 3.215633811115024138e-02, 2.159536983999914284e-02], 
-[3.678379771828634275e-03, 3.694513432520856594e-02, 2.169042205131607032e-02], 
-[3.678379771828634275e-03, 4.244708914272822542e-02, 2.180423808260225846e-02], 
-[3.678379771828634275e-03, 4.876840779169493850e-02, 2.194046013288220021e-02], 
-[3.678379771828634275e-03, 5.603111182818285713e-02, 2.210357610013919533e-02], 
-[3.678379771828634275e-03, 6.437539454049952259e-02, 2.229916032052983721e-02], 
-[3.678379771828634275e-03, 7.396232712556144451e-02, 2.253419741724632663e-02], 
-[3.678379771828634275e-03, 8.497696787531199003e-02, 2.281752338969291610e-02], 
-[3.678379771828634275e-03, 9.763193439036874088e-02, 2.316043460887281039e-02], 
-[3.678379771828634275e-03, 1.121715077759858903e-01, 2.357754137186044568e-02], 
-[3.678379771828634275e-03, 1.288763480443681220e-01, 2.408798448532345829e-02], 
-[3.678379771828634275e-03, 1.480689117455977755e-01, 2.471720244771159064e-02], 
-[3.678379771828634275e-03, 1.701196764046864207e-01, 2.549955445711973162e-02], 
-[3.678379771828634275e-03, 1.954542919161802172e-01, 2.648231175950417279e-02], 
-[3.678379771828634275e-03, 2.245617969409859638e-01, 2.773190960712911338e-02], 
-[3.678379771828634275e-03, 2.580040589080049296e-01, 2.934408000981934828e-02], 
-[3.678379771828634275e-03, 2.964266198426381838e-01, 3.146095659883690887e-02], 
-[3.678379771828634275e-03, 3.405711573811430193e-01, 3.430140912386021868e-02], 
-[3.678379771828634275e-03, 3.912898015080607528e-01, 3.821821771531726947e-02], 
-[3.678379771828634275e-03, 4.495615833752782953e-01, 4.381445502420956706e-02], 
-[3.678379771828634275e-03, 5.165113337172515529e-01, 5.220539614481199686e-02], 
-[3.678379771828634275e-03, 5.934313956619206021e-01, 6.569428873225846566e-02], 
-[3.678379771828634275e-03, 6.818065710636164178e-01, 8.990025721207636766e-02], 
-[3.678379771828634275e-03, 7.833427819015473803e-01, 1.430386682495817519e-01], 
-[3.678379771828634275e-03, 9.000000000000000222e-01, 3.369730036497009529e-01], 
-[3.678379771828634275e-03, 9.020408163265306589e-01, 3.444135357820602428e-01], 
-[3.678379771828634275e-03, 9.040816326530612956e-01, 3.521655830885561667e-01], 
-[3.678379771828634275e-03, 9.061224489795918213e-01, 3.602491764450286293e-01], 
-[3.678379771828634275e-03, 9.081632653061224580e-01, 3.686861084783300546e-01], 
-[3.678379771828634275e-03, 9.102040816326530948e-01, 3.775001320652711101e-01], 
-[3.678379771828634275e-03, 9.122448979591837315e-01, 3.867171863313196845e-01], 
-[3.678379771828634275e-03, 9.142857142857142572e-01, 3.963656547040180222e-01], 
-[3.678379771828634275e-03, 9.163265306122448939e-01, 4.064766604599535649e-01], 
-[3.678379771828634275e-03, 9.183673469387755306e-01, 4.170844062859924151e-01], 
-[3.678379771828634275e-03, 9.204081632653061673e-01, 4.282265657056512631e-01], 
-[3.678379771828634275e-03, 9.224489795918368040e-01, 4.399447358652340268e-01], 
-[3.678379771828634275e-03, 9.244897959183673297e-01, 4.522849632159390842e-01], 
-[3.678379771828634275e-03, 9.265306122448979664e-01, 4.652983561775513310e-01], 
-[3.678379771828634275e-03, 9.285714285714286031e-01, 4.790418020710262570e-01], 
-[3.678379771828634275e-03, 9.306122448979592399e-01, 4.935788096523696100e-01], 
-[3.678379771828634275e-03, 9.326530612244897656e-01, 5.089805037227721485e-01], 
-[3.678379771828634275e-03, 9.346938775510204023e-01, 5.253268048717563143e-01], 
-[3.678379771828634275e-03, 9.367346938775510390e-01, 5.427078358930437219e-01], 
-[3.678379771828634275e-03, 9.387755102040816757e-01, 5.612256074277885975e-01], 
-[3.678379771828634275e-03, 9.408163265306123124e-01, 5.809960498057680223e-01], 
-[3.678379771828634275e-03, 9.428571428571428381e-01, 6.021514770811731143e-01], 
-[3.678379771828634275e-03, 9.448979591836734748e-01, 6.248435945951340553e-01], 
-[3.678379771828634275e-03, 9.469387755102041115e-01, 6.492471954573828530e-01], 
-[3.678379771828634275e-03, 9.489795918367347483e-01, 6.755647375978759417e-01], 
-[3.678379771828634275e-03, 9.510204081632652739e-01, 7.040320565541526854e-01], 
-[3.678379771828634275e-03, 9.530612244897959107e-01, 7.349255573986711587e-01], 
-[3.678379771828634275e-03, 9.551020408163265474e-01, 7.685713533556958188e-01], 
-[3.678379771828634275e-03, 9.571428571428571841e-01, 8.053569957254818057e-01], 
-[3.678379771828634275e-03, 9.591836734693878208e-01, 8.457466960555064528e-01], 
-[3.678379771828634275e-03, 9.612244897959183465e-01, 8.903013185810924046e-01], 
-[3.678379771828634275e-03, 9.632653061224489832e-01, 9.397049855543565533e-01], 
-[3.678379771828634275e-03, 9.653061224489796199e-01, 9.948009999367506406e-01], 
-[3.678379771828634275e-03, 9.673469387755102566e-01, 1.056641133883542416e+00], 
-[3.678379771828634275e-03, 9.693877551020407823e-01, 1.126554477231720419e+00], 
-[3.678379771828634275e-03, 9.714285714285714191e-01, 1.206245557539312507e+00], 
-[3.678379771828634275e-03, 9.734693877551020558e-01, 1.297937381514888244e+00], 
-[3.678379771828634275e-03, 9.755102040816326925e-01, 1.404585413387879900e+00], 
-[3.678379771828634275e-03, 9.775510204081632182e-01, 1.530207301419272969e+00], 
-[3.678379771828634275e-03, 9.795918367346938549e-01, 1.680408771140083024e+00], 
-[3.678379771828634275e-03, 9.816326530612244916e-01, 1.863257092914682778e+00], 
-[3.678379771828634275e-03, 9.836734693877551283e-01, 2.090803859849950541e+00], 
-[3.678379771828634275e-03, 9.857142857142857650e-01, 2.381901102376581925e+00], 
-[3.678379771828634275e-03, 9.877551020408162907e-01, 2.767806815154956634e+00], 
-[3.678379771828634275e-03, 9.897959183673469274e-01, 3.304450015602671265e+00], 
-[3.678379771828634275e-03, 9.918367346938775642e-01, 4.102896809760735231e+00], 
-[3.678379771828634275e-03, 9.938775510204082009e-01, 5.420029598486633127e+00], 
-[3.678379771828634275e-03, 9.959183673469387266e-01, 8.017501068424135013e+00], 
-[3.678379771828634275e-03, 9.979591836734693633e-01, 1.563365782179706009e+01], 
-[3.678379771828634275e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[4.037017258596553408e-03, 1.000000000000000021e-03, 2.153812117627904379e-02], 
-[4.037017258596553408e-03, 1.148922311909569708e-03, 2.152633599517985927e-02], 
-[4.037017258596553408e-03, 1.320022478803632065e-03, 2.151500780459396356e-02], 
-[4.037017258596553408e-03, 1.516603278119670137e-03, 2.150420503974080633e-02], 
-[4.037017258596553408e-03, 1.742459344546885402e-03, 2.149400650797010648e-02], 
-[4.037017258596553408e-03, 2.001950418545241171e-03, 2.148450300010496666e-02], 
-[4.037017258596553408e-03, 2.300085503203331758e-03, 2.147579916445538015e-02], 
-[4.037017258596553408e-03, 2.642619553930058204e-03, 2.146801569031740742e-02], 
-[4.037017258596553408e-03, 3.036164567398761706e-03, 2.146129185683556470e-02], 
-[4.037017258596553408e-03, 3.488317214113704091e-03, 2.145578851520960756e-02], 
-[4.037017258596553408e-03, 4.007805478313466660e-03, 2.145169158642449420e-02], 
-[4.037017258596553408e-03, 4.604657135827751671e-03, 2.144921617496508767e-02], 
-[4.037017258596553408e-03, 5.290393322046124149e-03, 2.144861142179698213e-02], 
-[4.037017258596553408e-03, 6.078250926476181683e-03, 2.145016624879390182e-02], 
-[4.037017258596553408e-03, 6.983438106813499684e-03, 2.145421618372494316e-02], 
-[4.037017258596553408e-03, 8.023427854757562983e-03, 2.146115150199359375e-02], 
-[4.037017258596553408e-03, 9.218295280327699903e-03, 2.147142698244079023e-02], 
-[4.037017258596553408e-03, 1.059110512533918171e-02, 2.148557365351317847e-02], 
-[4.037017258596553408e-03, 1.216835698628199354e-02, 2.150421300954082071e-02], 
-[4.037017258596553408e-03, 1.398049684082008047e-02, 2.152807431287265955e-02], 
-[4.037017258596553408e-03, 1.606250475199945058e-02, 2.155801577779076911e-02], 
-[4.037017258596553408e-03, 1.845457009472566828e-02, 2.159505067246843268e-02], 
-[4.037017258596553408e-03, 2.120286733852943389e-02, 2.164037969841252351e-02], 
-[4.037017258596553408e-03, 2.436044736169515681e-02, 2.169543144442724614e-02], 
-[4.037017258596553408e-03, 2.798826150195019707e-02, 2.176191331038723753e-02], 
-[4.037017258596553408e-03, 3.215633811115024138e-02, 2.184187612058010805e-02], 
-[4.037017258596553408e-03, 3.694513432520856594e-02, 2.193779679440861774e-02], 
-[4.037017258596553408e-03, 4.244708914272822542e-02, 2.205268505748276403e-02], 
-[4.037017258596553408e-03, 4.876840779169493850e-02, 2.219022247523604399e-02], 
-[4.037017258596553408e-03, 5.603111182818285713e-02, 2.235494540540579333e-02], 
-[4.037017258596553408e-03, 6.437539454049952259e-02, 2.255248831025255182e-02], 
-[4.037017258596553408e-03, 7.396232712556144451e-02, 2.278991106067240063e-02], 
-[4.037017258596553408e-03, 8.497696787531199003e-02, 2.307614472258425614e-02], 
-[4.037017258596553408e-03, 9.763193439036874088e-02, 2.342260702424036126e-02], 
-[4.037017258596553408e-03, 1.121715077759858903e-01, 2.384406496137185527e-02], 
-[4.037017258596553408e-03, 1.288763480443681220e-01, 2.435986424959971433e-02], 
-[4.037017258596553408e-03, 1.480689117455977755e-01, 2.499571515077454037e-02], 
-[4.037017258596553408e-03, 1.701196764046864207e-01, 2.578634307569538722e-02], 
-[4.037017258596553408e-03, 1.954542919161802172e-01, 2.677952179344326999e-02], 
-[4.037017258596553408e-03, 2.245617969409859638e-01, 2.804239074101099252e-02], 
-[4.037017258596553408e-03, 2.580040589080049296e-01, 2.967169330532128807e-02], 
-[4.037017258596553408e-03, 2.964266198426381838e-01, 3.181105911978943795e-02], 
-[4.037017258596553408e-03, 3.405711573811430193e-01, 3.468165184200031059e-02], 
-[4.037017258596553408e-03, 3.912898015080607528e-01, 3.863993098943548088e-02], 
-[4.037017258596553408e-03, 4.495615833752782953e-01, 4.429522350552400622e-02], 
-[4.037017258596553408e-03, 5.165113337172515529e-01, 5.277429335881134165e-02], 
-[4.037017258596553408e-03, 5.934313956619206021e-01, 6.640392229838157356e-02], 
-[4.037017258596553408e-03, 6.818065710636164178e-01, 9.086005894690975249e-02], 
-[4.037017258596553408e-03, 7.833427819015473803e-01, 1.445396617416257745e-01], 
-[4.037017258596553408e-03, 9.000000000000000222e-01, 3.403941066938288573e-01], 
-[4.037017258596553408e-03, 9.020408163265306589e-01, 3.479071225575112170e-01], 
-[4.037017258596553408e-03, 9.040816326530612956e-01, 3.557346151034642689e-01], 
-[4.037017258596553408e-03, 9.061224489795918213e-01, 3.638968025018451957e-01], 
-[4.037017258596553408e-03, 9.081632653061224580e-01, 3.724156809405529400e-01], 
-[4.037017258596553408e-03, 9.102040816326530948e-01, 3.813152249383039427e-01], 
-[4.037017258596553408e-03, 9.122448979591837315e-01, 3.906216154066175505e-01], 
-[4.037017258596553408e-03, 9.142857142857142572e-01, 4.003635000566345692e-01], 
-[4.037017258596553408e-03, 9.163265306122448939e-01, 4.105722916384569876e-01], 
-[4.037017258596553408e-03, 9.183673469387755306e-01, 4.212825105922203273e-01], 
-[4.037017258596553408e-03, 9.204081632653061673e-01, 4.325321800321382248e-01], 
-[4.037017258596553408e-03, 9.224489795918368040e-01, 4.443632826431308525e-01], 
-[4.037017258596553408e-03, 9.244897959183673297e-01, 4.568222911293861044e-01], 
-[4.037017258596553408e-03, 9.265306122448979664e-01, 4.699607864262460577e-01], 
-[4.037017258596553408e-03, 9.285714285714286031e-01, 4.838361811169001880e-01], 
-[4.037017258596553408e-03, 9.306122448979592399e-01, 4.985125695762834819e-01], 
-[4.037017258596553408e-03, 9.326530612244897656e-01, 5.140617315526319064e-01], 
-[4.037017258596553408e-03, 9.346938775510204023e-01, 5.305643225370711979e-01], 
-[4.037017258596553408e-03, 9.367346938775510390e-01, 5.481112928293969677e-01], 
-[4.037017258596553408e-03, 9.387755102040816757e-01, 5.668055883201539302e-01], 
-[4.037017258596553408e-03, 9.408163265306123124e-01, 5.867642005518531878e-01], 
-[4.037017258596553408e-03, 9.428571428571428381e-01, 6.081206528152776070e-01], 
-[4.037017258596553408e-03, 9.448979591836734748e-01, 6.310280345944270231e-01], 
-[4.037017258596553408e-03, 9.469387755102041115e-01, 6.556627310320349844e-01], 
-[4.037017258596553408e-03, 9.489795918367347483e-01, 6.822290407501547804e-01], 
-[4.037017258596553408e-03, 9.510204081632652739e-01, 7.109649394292387736e-01], 
-[4.037017258596553408e-03, 9.530612244897959107e-01, 7.421493355557182703e-01], 
-[4.037017258596553408e-03, 9.551020408163265474e-01, 7.761112899720898906e-01], 
-[4.037017258596553408e-03, 9.571428571428571841e-01, 8.132418494670227149e-01], 
-[4.037017258596553408e-03, 9.591836734693878208e-01, 8.540094031829118526e-01], 
-[4.037017258596553408e-03, 9.612244897959183465e-01, 8.989798509565211093e-01], 
-[4.037017258596553408e-03, 9.632653061224489832e-01, 9.488434421682478970e-01], 
-[4.037017258596553408e-03, 9.653061224489796199e-01, 1.004451012937679133e+00], 
-[4.037017258596553408e-03, 9.673469387755102566e-01, 1.066863704975021365e+00], 
-[4.037017258596553408e-03, 9.693877551020407823e-01, 1.137422413522527265e+00], 
-[4.037017258596553408e-03, 9.714285714285714191e-01, 1.217846759135191581e+00], 
-[4.037017258596553408e-03, 9.734693877551020558e-01, 1.310379366798679390e+00], 
-[4.037017258596553408e-03, 9.755102040816326925e-01, 1.418001689384103425e+00], 
-[4.037017258596553408e-03, 9.775510204081632182e-01, 1.544766566713369205e+00], 
-[4.037017258596553408e-03, 9.795918367346938549e-01, 1.696328618261105259e+00], 
-[4.037017258596553408e-03, 9.816326530612244916e-01, 1.880825150887125874e+00], 
-[4.037017258596553408e-03, 9.836734693877551283e-01, 2.110411844319496577e+00], 
-[4.037017258596553408e-03, 9.857142857142857650e-01, 2.404102605788384750e+00], 
-[4.037017258596553408e-03, 9.877551020408162907e-01, 2.793422059760523712e+00], 
-[4.037017258596553408e-03, 9.897959183673469274e-01, 3.334772628670467753e+00], 
-[4.037017258596553408e-03, 9.918367346938775642e-01, 4.140151870636714193e+00], 
-[4.037017258596553408e-03, 9.938775510204082009e-01, 5.468571721073232972e+00], 
-[4.037017258596553408e-03, 9.959183673469387266e-01, 8.087900903667431862e+00], 
-[4.037017258596553408e-03, 9.979591836734693633e-01, 1.576623713222790890e+01], 
-[4.037017258596553408e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[4.430621457583882282e-03, 1.000000000000000021e-03, 2.178583503368012458e-02], 
-[4.430621457583882282e-03, 1.148922311909569708e-03, 2.177375255646914545e-02], 
-[4.430621457583882282e-03, 1.320022478803632065e-03, 2.176213205580641158e-02], 
-[4.430621457583882282e-03, 1.516603278119670137e-03, 2.175104271001231104e-02], 
-[4.430621457583882282e-03, 1.742459344546885402e-03, 2.174056418164303783e-02], 
-[4.430621457583882282e-03, 2.001950418545241171e-03, 2.173078824617537264e-02], 
-[4.430621457583882282e-03, 2.300085503203331758e-03, 2.172182068618360579e-02], 
-[4.430621457583882282e-03, 2.642619553930058204e-03, 2.171378349830950516e-02], 
-[4.430621457583882282e-03, 3.036164567398761706e-03, 2.170681746952417973e-02], 
-[4.430621457583882282e-03, 3.488317214113704091e-03, 2.170108519136869710e-02], 
-[4.430621457583882282e-03, 4.007805478313466660e-03, 2.169677459524171903e-02], 
-[4.430621457583882282e-03, 4.604657135827751671e-03, 2.169410311027576005e-02], 
-[4.430621457583882282e-03, 5.290393322046124149e-03, 2.169332256833488015e-02], 
-[4.430621457583882282e-03, 6.078250926476181683e-03, 2.169472501013876287e-02], 
-[4.430621457583882282e-03, 6.983438106813499684e-03, 2.169864958330950874e-02], 
-[4.430621457583882282e-03, 8.023427854757562983e-03, 2.170549077139172570e-02], 
-[4.430621457583882282e-03, 9.218295280327699903e-03, 2.171570825412183492e-02], 
-[4.430621457583882282e-03, 1.059110512533918171e-02, 2.172983877932685090e-02], 
-[4.430621457583882282e-03, 1.216835698628199354e-02, 2.174851053129388256e-02], 
-[4.430621457583882282e-03, 1.398049684082008047e-02, 2.177246061790826664e-02], 
-[4.430621457583882282e-03, 1.606250475199945058e-02, 2.180255648093854665e-02], 
-[4.430621457583882282e-03, 1.845457009472566828e-02, 2.183982227673623294e-02], 
-[4.430621457583882282e-03, 2.120286733852943389e-02, 2.188547160119840712e-02], 
-[4.430621457583882282e-03, 2.436044736169515681e-02, 2.194094837506989359e-02], 
-[4.430621457583882282e-03, 2.798826150195019707e-02, 2.200797831019628975e-02], 
-[4.430621457583882282e-03, 3.215633811115024138e-02, 2.208863421049226533e-02], 
-[4.430621457583882282e-03, 3.694513432520856594e-02, 2.218541952146704799e-02], 
-[4.430621457583882282e-03, 4.244708914272822542e-02, 2.230137617431508790e-02], 
-[4.430621457583882282e-03, 4.876840779169493850e-02, 2.244022509373091306e-02], 
-[4.430621457583882282e-03, 5.603111182818285713e-02, 2.260655108740823593e-02], 
-[4.430621457583882282e-03, 6.437539454049952259e-02, 2.280604873018529655e-02], 
-[4.430621457583882282e-03, 7.396232712556144451e-02, 2.304585312183005108e-02], 
-[4.430621457583882282e-03, 8.497696787531199003e-02, 2.333499036830397055e-02], 
-[4.430621457583882282e-03, 9.763193439036874088e-02, 2.368499951749467036e-02], 
-[4.430621457583882282e-03, 1.121715077759858903e-01, 2.411080420970526314e-02], 
-[4.430621457583882282e-03, 1.288763480443681220e-01, 2.463195499070811034e-02], 
-[4.430621457583882282e-03, 1.480689117455977755e-01, 2.527443376923944190e-02], 
-[4.430621457583882282e-03, 1.701196764046864207e-01, 2.607333199365273468e-02], 
-[4.430621457583882282e-03, 1.954542919161802172e-01, 2.707692568785474013e-02], 
-[4.430621457583882282e-03, 2.245617969409859638e-01, 2.835305805351725009e-02], 
-[4.430621457583882282e-03, 2.580040589080049296e-01, 2.999948317990808536e-02], 
-[4.430621457583882282e-03, 2.964266198426381838e-01, 3.216132558469639996e-02], 
-[4.430621457583882282e-03, 3.405711573811430193e-01, 3.506204090968871590e-02], 
-[4.430621457583882282e-03, 3.912898015080607528e-01, 3.906176458726851042e-02], 
-[4.430621457583882282e-03, 4.495615833752782953e-01, 4.477607118629430699e-02], 
-[4.430621457583882282e-03, 5.165113337172515529e-01, 5.334319963818347915e-02], 
-[4.430621457583882282e-03, 5.934313956619206021e-01, 6.711343314312101516e-02], 
-[4.430621457583882282e-03, 6.818065710636164178e-01, 9.181945298189686522e-02], 
-[4.430621457583882282e-03, 7.833427819015473803e-01, 1.460394606334482204e-01], 
-[4.430621457583882282e-03, 9.000000000000000222e-01, 3.438100533299520700e-01], 
-[4.430621457583882282e-03, 9.020408163265306589e-01, 3.513953778657419313e-01], 
-[4.430621457583882282e-03, 9.040816326530612956e-01, 3.592981318531691670e-01], 
-[4.430621457583882282e-03, 9.061224489795918213e-01, 3.675387201358791822e-01], 
-[4.430621457583882282e-03, 9.081632653061224580e-01, 3.761393417835765529e-01], 
-[4.430621457583882282e-03, 9.102040816326530948e-01, 3.851241922123103123e-01], 
-[4.430621457583882282e-03, 9.122448979591837315e-01, 3.945196933018266239e-01], 
-[4.430621457583882282e-03, 9.142857142857142572e-01, 4.043547561466989682e-01], 
-[4.430621457583882282e-03, 9.163265306122448939e-01, 4.146610819775742307e-01], 
-[4.430621457583882282e-03, 9.183673469387755306e-01, 4.254735078900022116e-01], 
-[4.430621457583882282e-03, 9.204081632653061673e-01, 4.368304053721480118e-01], 
-[4.430621457583882282e-03, 9.224489795918368040e-01, 4.487741412956264275e-01], 
-[4.430621457583882282e-03, 9.244897959183673297e-01, 4.613516131115075747e-01], 
-[4.430621457583882282e-03, 9.265306122448979664e-01, 4.746148725881148556e-01], 
-[4.430621457583882282e-03, 9.285714285714286031e-01, 4.886218556856039563e-01], 
-[4.430621457583882282e-03, 9.306122448979592399e-01, 5.034372402788858114e-01], 
-[4.430621457583882282e-03, 9.326530612244897656e-01, 5.191334586737936796e-01], 
-[4.430621457583882282e-03, 9.346938775510204023e-01, 5.357918985591881844e-01], 
-[4.430621457583882282e-03, 9.367346938775510390e-01, 5.535043346699636269e-01], 
-[4.430621457583882282e-03, 9.387755102040816757e-01, 5.723746446444235580e-01], 
-[4.430621457583882282e-03, 9.408163265306123124e-01, 5.925208772284236147e-01], 
-[4.430621457583882282e-03, 9.428571428571428381e-01, 6.140777603380747074e-01], 
-[4.430621457583882282e-03, 9.448979591836734748e-01, 6.371997622714453691e-01], 
-[4.430621457583882282e-03, 9.469387755102041115e-01, 6.620648540147795469e-01], 
-[4.430621457583882282e-03, 9.489795918367347483e-01, 6.888791676535271913e-01], 
-[4.430621457583882282e-03, 9.510204081632652739e-01, 7.178828105186763064e-01], 
-[4.430621457583882282e-03, 9.530612244897959107e-01, 7.493571844698528883e-01], 
-[4.430621457583882282e-03, 9.551020408163265474e-01, 7.836342860139754452e-01], 
-[4.430621457583882282e-03, 9.571428571428571841e-01, 8.211086430894883881e-01], 
-[4.430621457583882282e-03, 9.591836734693878208e-01, 8.622528050928657262e-01], 
-[4.430621457583882282e-03, 9.612244897959183465e-01, 9.076376863014298246e-01], 
-[4.430621457583882282e-03, 9.632653061224489832e-01, 9.579596371448164671e-01], 
-[4.430621457583882282e-03, 9.653061224489796199e-01, 1.014076994407066001e+00], 
-[4.430621457583882282e-03, 9.673469387755102566e-01, 1.077060228371810036e+00], 
-[4.430621457583882282e-03, 9.693877551020407823e-01, 1.148261987292007014e+00], 
-[4.430621457583882282e-03, 9.714285714285714191e-01, 1.229416916698853779e+00], 
-[4.430621457583882282e-03, 9.734693877551020558e-01, 1.322787169997855061e+00], 
-[4.430621457583882282e-03, 9.755102040816326925e-01, 1.431380067608828188e+00], 
-[4.430621457583882282e-03, 9.775510204081632182e-01, 1.559283473922401742e+00], 
-[4.430621457583882282e-03, 9.795918367346938549e-01, 1.712200665768718544e+00], 
-[4.430621457583882282e-03, 9.816326530612244916e-01, 1.898338640403459010e+00], 
-[4.430621457583882282e-03, 9.836734693877551283e-01, 2.129956637914536266e+00], 
-[4.430621457583882282e-03, 9.857142857142857650e-01, 2.426229603081149655e+00], 
-[4.430621457583882282e-03, 9.877551020408162907e-01, 2.818947368699246336e+00], 
-[4.430621457583882282e-03, 9.897959183673469274e-01, 3.364983157339120901e+00], 
-[4.430621457583882282e-03, 9.918367346938775642e-01, 4.177260662527442214e+00], 
-[4.430621457583882282e-03, 9.938775510204082009e-01, 5.516908649801031572e+00], 
-[4.430621457583882282e-03, 9.959183673469387266e-01, 8.157972623421992253e+00], 
-[4.430621457583882282e-03, 9.979591836734693633e-01, 1.589809670515845141e+01], 
-[4.430621457583882282e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[4.862601580065353639e-03, 1.000000000000000021e-03, 2.203389629555639606e-02], 
-[4.862601580065353639e-03, 1.148922311909569708e-03, 2.202151268187440419e-02], 
-[4.862601580065353639e-03, 1.320022478803632065e-03, 2.200959603196882622e-02], 
-[4.862601580065353639e-03, 1.516603278119670137e-03, 2.199821626736540511e-02], 
-[4.862601580065353639e-03, 1.742459344546885402e-03, 2.198745390593619120e-02], 
-[4.862601580065353639e-03, 2.001950418545241171e-03, 2.197740170792539249e-02], 
-[4.862601580065353639e-03, 2.300085503203331758e-03, 2.196816659028825308e-02], 
-[4.862601580065353639e-03, 2.642619553930058204e-03, 2.195987185713092413e-02], 
-[4.862601580065353639e-03, 3.036164567398761706e-03, 2.195265980336921774e-02], 
-[4.862601580065353639e-03, 3.488317214113704091e-03, 2.194669476100075123e-02], 
-[4.862601580065353639e-03, 4.007805478313466660e-03, 2.194216667194656689e-02], 
-[4.862601580065353639e-03, 4.604657135827751671e-03, 2.193929529007004886e-02], 
-[4.862601580065353639e-03, 5.290393322046124149e-03, 2.193833513825438342e-02], 
-[4.862601580065353639e-03, 6.078250926476181683e-03, 2.193958137608710210e-02], 
-[4.862601580065353639e-03, 6.983438106813499684e-03, 2.194337677107722692e-02], 
-[4.862601580065353639e-03, 8.023427854757562983e-03, 2.195012001488869102e-02], 
-[4.862601580065353639e-03, 9.218295280327699903e-03, 2.196027568807062957e-02], 
-[4.862601580065353639e-03, 1.059110512533918171e-02, 2.197438625766694187e-02], 
-[4.862601580065353639e-03, 1.216835698628199354e-02, 2.199308659765197502e-02], 
-[4.862601580065353639e-03, 1.398049684082008047e-02, 2.201712166103781884e-02], 
-[4.862601580065353639e-03, 1.606250475199945058e-02, 2.204736811648663752e-02], 
-[4.862601580065353639e-03, 1.845457009472566828e-02, 2.208486100769424879e-02], 
-[4.862601580065353639e-03, 2.120286733852943389e-02, 2.213082682379648863e-02], 
-[4.862601580065353639e-03, 2.436044736169515681e-02, 2.218672481590662493e-02], 
-[4.862601580065353639e-03, 2.798826150195019707e-02, 2.225429900570852215e-02], 
-[4.862601580065353639e-03, 3.215633811115024138e-02, 2.233564417385912326e-02], 
-[4.862601580065353639e-03, 3.694513432520856594e-02, 2.243329028807197756e-02], 
-[4.862601580065353639e-03, 4.244708914272822542e-02, 2.255031147983563300e-02], 
-[4.862601580065353639e-03, 4.876840779169493850e-02, 2.269046802590271583e-02], 
-[4.862601580065353639e-03, 5.603111182818285713e-02, 2.285839317405888305e-02], 
-[4.862601580065353639e-03, 6.437539454049952259e-02, 2.305984159811233503e-02], 
-[4.862601580065353639e-03, 7.396232712556144451e-02, 2.330202360777055420e-02], 
-[4.862601580065353639e-03, 8.497696787531199003e-02, 2.359406032244122306e-02], 
-[4.862601580065353639e-03, 9.763193439036874088e-02, 2.394761207187856566e-02], 
-[4.862601580065353639e-03, 1.121715077759858903e-01, 2.437775908667776104e-02], 
-[4.862601580065353639e-03, 1.288763480443681220e-01, 2.490425666371303207e-02], 
-[4.862601580065353639e-03, 1.480689117455977755e-01, 2.555335824177404347e-02], 
-[4.862601580065353639e-03, 1.701196764046864207e-01, 2.636052113120922885e-02], 
-[4.862601580065353639e-03, 1.954542919161802172e-01, 2.737452334191783909e-02], 
-[4.862601580065353639e-03, 2.245617969409859638e-01, 2.866391141949716295e-02], 
-[4.862601580065353639e-03, 2.580040589080049296e-01, 3.032744947987276243e-02], 
-[4.862601580065353639e-03, 2.964266198426381838e-01, 3.251175580582046920e-02], 
-[4.862601580065353639e-03, 3.405711573811430193e-01, 3.544257609802110853e-02], 
-[4.862601580065353639e-03, 3.912898015080607528e-01, 3.948371822944030107e-02], 
-[4.862601580065353639e-03, 4.495615833752782953e-01, 4.525699772476200061e-02], 
-[4.862601580065353639e-03, 5.165113337172515529e-01, 5.391211456469448271e-02], 
-[4.862601580065353639e-03, 5.934313956619206021e-01, 6.782282076052502384e-02], 
-[4.862601580065353639e-03, 6.818065710636164178e-01, 9.277843874486332854e-02], 
-[4.862601580065353639e-03, 7.833427819015473803e-01, 1.475380645480656450e-01], 
-[4.862601580065353639e-03, 9.000000000000000222e-01, 3.472208468431906003e-01], 
-[4.862601580065353639e-03, 9.020408163265306589e-01, 3.548783052070347277e-01], 
-[4.862601580065353639e-03, 9.040816326530612956e-01, 3.628561370672129249e-01], 
-[4.862601580065353639e-03, 9.061224489795918213e-01, 3.711749333211946666e-01], 
-[4.862601580065353639e-03, 9.081632653061224580e-01, 3.798570952425372460e-01], 
-[4.862601580065353639e-03, 9.102040816326530948e-01, 3.889270384014737458e-01], 
-[4.862601580065353639e-03, 9.122448979591837315e-01, 3.984114248297307981e-01], 
-[4.862601580065353639e-03, 9.142857142857142572e-01, 4.083394281069043230e-01], 
-[4.862601580065353639e-03, 9.163265306122448939e-01, 4.187430369531714991e-01], 
-[4.862601580065353639e-03, 9.183673469387755306e-01, 4.296574040238223535e-01], 
-[4.862601580065353639e-03, 9.204081632653061673e-01, 4.411212479666697939e-01], 
-[4.862601580065353639e-03, 9.224489795918368040e-01, 4.531773184908436392e-01], 
-[4.862601580065353639e-03, 9.244897959183673297e-01, 4.658729362912721883e-01], 
-[4.862601580065353639e-03, 9.265306122448979664e-01, 4.792606222901654167e-01], 
-[4.862601580065353639e-03, 9.285714285714286031e-01, 4.933988339433191816e-01], 
-[4.862601580065353639e-03, 9.306122448979592399e-01, 5.083528305111435497e-01], 
-[4.862601580065353639e-03, 9.326530612244897656e-01, 5.241956944727224066e-01], 
-[4.862601580065353639e-03, 9.346938775510204023e-01, 5.410095430166225183e-01], 
-[4.862601580065353639e-03, 9.367346938775510390e-01, 5.588869722485645397e-01], 
-[4.862601580065353639e-03, 9.387755102040816757e-01, 5.779327880607081358e-01], 
-[4.862601580065353639e-03, 9.408163265306123124e-01, 5.982660924018197157e-01], 
-[4.862601580065353639e-03, 9.428571428571428381e-01, 6.200228132124940839e-01], 
-[4.862601580065353639e-03, 9.448979591836734748e-01, 6.433587922882517685e-01], 
-[4.862601580065353639e-03, 9.469387755102041115e-01, 6.684535802836863994e-01], 
-[4.862601580065353639e-03, 9.489795918367347483e-01, 6.955151355358876186e-01], 
-[4.862601580065353639e-03, 9.510204081632652739e-01, 7.247856885541651417e-01], 
-[4.862601580065353639e-03, 9.530612244897959107e-01, 7.565491245547147914e-01], 
-[4.862601580065353639e-03, 9.551020408163265474e-01, 7.911403637842140402e-01], 
-[4.862601580065353639e-03, 9.571428571428571841e-01, 8.289574010276925531e-01], 
-[4.862601580065353639e-03, 9.591836734693878208e-01, 8.704769286383502447e-01], 
-[4.862601580065353639e-03, 9.612244897959183465e-01, 9.162748542270361396e-01], 
-[4.862601580065353639e-03, 9.632653061224489832e-01, 9.670536032609637900e-01], 
-[4.862601580065353639e-03, 9.653061224489796199e-01, 1.023678980780232006e+00], 
-[4.862601580065353639e-03, 9.673469387755102566e-01, 1.087230744769725366e+00], 
-[4.862601580065353639e-03, 9.693877551020407823e-01, 1.159073244240695022e+00], 
-[4.862601580065353639e-03, 9.714285714285714191e-01, 1.240956081867674587e+00], 
-[4.862601580065353639e-03, 9.734693877551020558e-01, 1.335160849871565469e+00], 
-[4.862601580065353639e-03, 9.755102040816326925e-01, 1.444720615475334036e+00], 
-[4.862601580065353639e-03, 9.775510204081632182e-01, 1.573758101135186660e+00], 
-[4.862601580065353639e-03, 9.795918367346938549e-01, 1.728025005156842209e+00], 
-[4.862601580065353639e-03, 9.816326530612244916e-01, 1.915797670152668664e+00], 
-[4.862601580065353639e-03, 9.836734693877551283e-01, 2.149438371962474559e+00], 
-[4.862601580065353639e-03, 9.857142857142857650e-01, 2.448282256373500054e+00], 
-[4.862601580065353639e-03, 9.877551020408162907e-01, 2.844382947763028024e+00], 
-[4.862601580065353639e-03, 9.897959183673469274e-01, 3.395081872917974586e+00], 
-[4.862601580065353639e-03, 9.918367346938775642e-01, 4.214223563113311144e+00], 
-[4.862601580065353639e-03, 9.938775510204082009e-01, 5.565040957122697307e+00], 
-[4.862601580065353639e-03, 9.959183673469387266e-01, 8.227717238992070747e+00], 
-[4.862601580065353639e-03, 9.979591836734693633e-01, 1.602923911895939568e+01], 
-[4.862601580065353639e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[5.336699231206312212e-03, 1.000000000000000021e-03, 2.228230520508026058e-02], 
-[5.336699231206312212e-03, 1.148922311909569708e-03, 2.226961660781780900e-02], 
-[5.336699231206312212e-03, 1.320022478803632065e-03, 2.225739996274462423e-02], 
-[5.336699231206312212e-03, 1.516603278119670137e-03, 2.224572593469494736e-02], 
-[5.336699231206312212e-03, 1.742459344546885402e-03, 2.223467589696475830e-02], 
-[5.336699231206312212e-03, 2.001950418545241171e-03, 2.222434359467780757e-02], 
-[5.336699231206312212e-03, 2.300085503203331758e-03, 2.221483707928512477e-02], 
-[5.336699231206312212e-03, 2.642619553930058204e-03, 2.220628096247377614e-02], 
-[5.336699231206312212e-03, 3.036164567398761706e-03, 2.219881904722005583e-02], 
-[5.336699231206312212e-03, 3.488317214113704091e-03, 2.219261740609051667e-02], 
-[5.336699231206312212e-03, 4.007805478313466660e-03, 2.218786799163413592e-02], 
-[5.336699231206312212e-03, 4.604657135827751671e-03, 2.218479288254810583e-02], 
-[5.336699231206312212e-03, 5.290393322046124149e-03, 2.218364929279402487e-02], 
-[5.336699231206312212e-03, 6.078250926476181683e-03, 2.218473550088837995e-02], 
-[5.336699231206312212e-03, 6.983438106813499684e-03, 2.218839789424514874e-02], 
-[5.336699231206312212e-03, 8.023427854757562983e-03, 2.219503937261923382e-02], 
-[5.336699231206312212e-03, 9.218295280327699903e-03, 2.220512941727829925e-02], 
-[5.336699231206312212e-03, 1.059110512533918171e-02, 2.221921621431883001e-02], 
-[5.336699231206312212e-03, 1.216835698628199354e-02, 2.223794132711840593e-02], 
-[5.336699231206312212e-03, 1.398049684082008047e-02, 2.226205755339455764e-02], 
-[5.336699231206312212e-03, 1.606250475199945058e-02, 2.229245078809636432e-02], 
-[5.336699231206312212e-03, 1.845457009472566828e-02, 2.233016696141380125e-02], 
-[5.336699231206312212e-03, 2.120286733852943389e-02, 2.237644545455097847e-02], 
-[5.336699231206312212e-03, 2.436044736169515681e-02, 2.243276084739497661e-02], 
-[5.336699231206312212e-03, 2.798826150195019707e-02, 2.250087546930860591e-02], 
-[5.336699231206312212e-03, 3.215633811115024138e-02, 2.258290607477458564e-02], 
-[5.336699231206312212e-03, 3.694513432520856594e-02, 2.268140914977083422e-02], 
-[5.336699231206312212e-03, 4.244708914272822542e-02, 2.279949102074409900e-02], 
-[5.336699231206312212e-03, 4.876840779169493850e-02, 2.294095130924728859e-02], 
-[5.336699231206312212e-03, 5.603111182818285713e-02, 2.311047169322695896e-02], 
-[5.336699231206312212e-03, 6.437539454049952259e-02, 2.331386693177193992e-02], 
-[5.336699231206312212e-03, 7.396232712556144451e-02, 2.355842252549677010e-02], 
-[5.336699231206312212e-03, 8.497696787531199003e-02, 2.385335458053475938e-02], 
-[5.336699231206312212e-03, 9.763193439036874088e-02, 2.421044467058436345e-02], 
-[5.336699231206312212e-03, 1.121715077759858903e-01, 2.464492956205412838e-02], 
-[5.336699231206312212e-03, 1.288763480443681220e-01, 2.517676922362714967e-02], 
-[5.336699231206312212e-03, 1.480689117455977755e-01, 2.583248850699641080e-02], 
-[5.336699231206312212e-03, 1.701196764046864207e-01, 2.664791040853687482e-02], 
-[5.336699231206312212e-03, 1.954542919161802172e-01, 2.767231465477335700e-02], 
-[5.336699231206312212e-03, 2.245617969409859638e-01, 2.897495071377267917e-02], 
-[5.336699231206312212e-03, 2.580040589080049296e-01, 3.065559205149805469e-02], 
-[5.336699231206312212e-03, 2.964266198426381838e-01, 3.286234959543986311e-02], 
-[5.336699231206312212e-03, 3.405711573811430193e-01, 3.582325717814781318e-02], 
-[5.336699231206312212e-03, 3.912898015080607528e-01, 3.990579163668975943e-02], 
-[5.336699231206312212e-03, 4.495615833752782953e-01, 4.573800277937862396e-02], 
-[5.336699231206312212e-03, 5.165113337172515529e-01, 5.448103772047620252e-02], 
-[5.336699231206312212e-03, 5.934313956619206021e-01, 6.853208464527763000e-02], 
-[5.336699231206312212e-03, 6.818065710636164178e-01, 9.373701566477586622e-02], 
-[5.336699231206312212e-03, 7.833427819015473803e-01, 1.490354731106732777e-01], 
-[5.336699231206312212e-03, 9.000000000000000222e-01, 3.506264905219514949e-01], 
-[5.336699231206312212e-03, 9.020408163265306589e-01, 3.583559080849000877e-01], 
-[5.336699231206312212e-03, 9.040816326530612956e-01, 3.664086344782947480e-01], 
-[5.336699231206312212e-03, 9.061224489795918213e-01, 3.748054460349301564e-01], 
-[5.336699231206312212e-03, 9.081632653061224580e-01, 3.835689455555493232e-01], 
-[5.336699231206312212e-03, 9.102040816326530948e-01, 3.927237680228435890e-01], 
-[5.336699231206312212e-03, 9.122448979591837315e-01, 4.022968148058520543e-01], 
-[5.336699231206312212e-03, 9.142857142857142572e-01, 4.123175210725346096e-01], 
-[5.336699231206312212e-03, 9.163265306122448939e-01, 4.228181620435361165e-01], 
-[5.336699231206312212e-03, 9.183673469387755306e-01, 4.338342048403927009e-01], 
-[5.336699231206312212e-03, 9.204081632653061673e-01, 4.454047140587009679e-01], 
-[5.336699231206312212e-03, 9.224489795918368040e-01, 4.575728208986628021e-01], 
-[5.336699231206312212e-03, 9.244897959183673297e-01, 4.703862677991212937e-01], 
-[5.336699231206312212e-03, 9.265306122448979664e-01, 4.838980431605537369e-01], 
-[5.336699231206312212e-03, 9.285714285714286031e-01, 4.981671240570073600e-01], 
-[5.336699231206312212e-03, 9.306122448979592399e-01, 5.132593490243841927e-01], 
-[5.336699231206312212e-03, 9.326530612244897656e-01, 5.292484483357693392e-01], 
-[5.336699231206312212e-03, 9.346938775510204023e-01, 5.462172659872331915e-01], 
-[5.336699231206312212e-03, 9.367346938775510390e-01, 5.642592163977460107e-01], 
-[5.336699231206312212e-03, 9.387755102040816757e-01, 5.834800302271410111e-01], 
-[5.336699231206312212e-03, 9.408163265306123124e-01, 6.039998586356014609e-01], 
-[5.336699231206312212e-03, 9.428571428571428381e-01, 6.259558249977643651e-01], 
-[5.336699231206312212e-03, 9.448979591836734748e-01, 6.495051393021555874e-01], 
-[5.336699231206312212e-03, 9.469387755102041115e-01, 6.748289257108597283e-01], 
-[5.336699231206312212e-03, 9.489795918367347483e-01, 7.021369616177681738e-01], 
-[5.336699231206312212e-03, 9.510204081632652739e-01, 7.316735922584296503e-01], 
-[5.336699231206312212e-03, 9.530612244897959107e-01, 7.637251762130974342e-01], 
-[5.336699231206312212e-03, 9.551020408163265474e-01, 7.986295455726410975e-01], 
-[5.336699231206312212e-03, 9.571428571428571841e-01, 8.367881477008711766e-01], 
-[5.336699231206312212e-03, 9.591836734693878208e-01, 8.786818006537715497e-01], 
-[5.336699231206312212e-03, 9.612244897959183465e-01, 9.248913843224360054e-01], 
-[5.336699231206312212e-03, 9.632653061224489832e-01, 9.761253732672543482e-01], 
-[5.336699231206312212e-03, 9.653061224489796199e-01, 1.033257008461110349e+00], 
-[5.336699231206312212e-03, 9.673469387755102566e-01, 1.097375294827086289e+00], 
-[5.336699231206312212e-03, 9.693877551020407823e-01, 1.169856230024213017e+00], 
-[5.336699231206312212e-03, 9.714285714285714191e-01, 1.252464306224971624e+00], 
-[5.336699231206312212e-03, 9.734693877551020558e-01, 1.347500465113517620e+00], 
-[5.336699231206312212e-03, 9.755102040816326925e-01, 1.458023400317075557e+00], 
-[5.336699231206312212e-03, 9.775510204081632182e-01, 1.588190526342258657e+00], 
-[5.336699231206312212e-03, 9.795918367346938549e-01, 1.743801727796975287e+00], 
-[5.336699231206312212e-03, 9.816326530612244916e-01, 1.933202348669013748e+00], 
-[5.336699231206312212e-03, 9.836734693877551283e-01, 2.168857177591460239e+00], 
-[5.336699231206312212e-03, 9.857142857142857650e-01, 2.470260727521452981e+00], 
-[5.336699231206312212e-03, 9.877551020408162907e-01, 2.869729002386527839e+00], 
-[5.336699231206312212e-03, 9.897959183673469274e-01, 3.425069046209090473e+00], 
-[5.336699231206312212e-03, 9.918367346938775642e-01, 4.251040949308175776e+00], 
-[5.336699231206312212e-03, 9.938775510204082009e-01, 5.612969214214010627e+00], 
-[5.336699231206312212e-03, 9.959183673469387266e-01, 8.297135759147074907e+00], 
-[5.336699231206312212e-03, 9.979591836734693633e-01, 1.615966694435552142e+01], 
-[5.336699231206312212e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[5.857020818056667653e-03, 1.000000000000000021e-03, 2.253106200550933358e-02], 
-[5.857020818056667653e-03, 1.148922311909569708e-03, 2.251806457080263169e-02], 
-[5.857020818056667653e-03, 1.320022478803632065e-03, 2.250554407787418165e-02], 
-[5.857020818056667653e-03, 1.516603278119670137e-03, 2.249357193496872437e-02], 
-[5.857020818056667653e-03, 1.742459344546885402e-03, 2.248223037091275078e-02], 
-[5.857020818056667653e-03, 2.001950418545241171e-03, 2.247161411582011131e-02], 
-[5.857020818056667653e-03, 2.300085503203331758e-03, 2.246183235575063136e-02], 
-[5.857020818056667653e-03, 2.642619553930058204e-03, 2.245301101008671460e-02], 
-[5.857020818056667653e-03, 3.036164567398761706e-03, 2.244529538997849100e-02], 
-[5.857020818056667653e-03, 3.488317214113704091e-03, 2.243885330867107647e-02], 
-[5.857020818056667653e-03, 4.007805478313466660e-03, 2.243387872944375971e-02], 
-[5.857020818056667653e-03, 4.604657135827751671e-03, 2.243059605591374989e-02], 
-[5.857020818056667653e-03, 5.290393322046124149e-03, 2.242926519320226353e-02], 
-[5.857020818056667653e-03, 6.078250926476181683e-03, 2.243018753879791674e-02], 
-[5.857020818056667653e-03, 6.983438106813499684e-03, 2.243371310003205304e-02], 
-[5.857020818056667653e-03, 8.023427854757562983e-03, 2.244024898471575283e-02], 
-[5.857020818056667653e-03, 9.218295280327699903e-03, 2.245026957474532264e-02], 
-[5.857020818056667653e-03, 1.059110512533918171e-02, 2.246432877507313283e-02], 
-[5.857020818056667653e-03, 1.216835698628199354e-02, 2.248307483819777727e-02], 
-[5.857020818056667653e-03, 1.398049684082008047e-02, 2.250726840610544136e-02], 
-[5.857020818056667653e-03, 1.606250475199945058e-02, 2.253780459941873843e-02], 
-[5.857020818056667653e-03, 1.845457009472566828e-02, 2.257574023395194154e-02], 
-[5.857020818056667653e-03, 2.120286733852943389e-02, 2.262232758178792449e-02], 
-[5.857020818056667653e-03, 2.436044736169515681e-02, 2.267905654997045412e-02], 
-[5.857020818056667653e-03, 2.798826150195019707e-02, 2.274770777335533359e-02], 
-[5.857020818056667653e-03, 3.215633811115024138e-02, 2.283041997730296535e-02], 
-[5.857020818056667653e-03, 3.694513432520856594e-02, 2.292977616207778763e-02], 
-[5.857020818056667653e-03, 4.244708914272822542e-02, 2.304891484370345800e-02], 
-[5.857020818056667653e-03, 4.876840779169493850e-02, 2.319167498122047533e-02], 
-[5.857020818056667653e-03, 5.603111182818285713e-02, 2.336278667273854887e-02], 
-[5.857020818056667653e-03, 6.437539454049952259e-02, 2.356812474885647268e-02], 
-[5.857020818056667653e-03, 7.396232712556144451e-02, 2.381504988196313927e-02], 
-[5.857020818056667653e-03, 8.497696787531199003e-02, 2.411287313807295232e-02], 
-[5.857020818056667653e-03, 9.763193439036874088e-02, 2.447349729674865026e-02], 
-[5.857020818056667653e-03, 1.121715077759858903e-01, 2.491231560554684268e-02], 
-[5.857020818056667653e-03, 1.288763480443681220e-01, 2.544949262541140733e-02], 
-[5.857020818056667653e-03, 1.480689117455977755e-01, 2.611182450347501044e-02], 
-[5.857020818056667653e-03, 1.701196764046864207e-01, 2.693549974576220016e-02], 
-[5.857020818056667653e-03, 1.954542919161802172e-01, 2.797029952552368762e-02], 
-[5.857020818056667653e-03, 2.245617969409859638e-01, 2.928617581113848040e-02], 
-[5.857020818056667653e-03, 2.580040589080049296e-01, 3.098391074105646265e-02], 
-[5.857020818056667653e-03, 2.964266198426381838e-01, 3.321310676584834226e-02], 
-[5.857020818056667653e-03, 3.405711573811430193e-01, 3.620408392127390934e-02], 
-[5.857020818056667653e-03, 3.912898015080607528e-01, 4.032798452987075566e-02], 
-[5.857020818056667653e-03, 4.495615833752782953e-01, 4.621908600880569179e-02], 
-[5.857020818056667653e-03, 5.165113337172515529e-01, 5.504996868802627952e-02], 
-[5.857020818056667653e-03, 5.934313956619206021e-01, 6.924122429269816137e-02], 
-[5.857020818056667653e-03, 6.818065710636164178e-01, 9.469518317174113742e-02], 
-[5.857020818056667653e-03, 7.833427819015473803e-01, 1.505316859486405812e-01], 
-[5.857020818056667653e-03, 9.000000000000000222e-01, 3.540269876579132946e-01], 
-[5.857020818056667653e-03, 9.020408163265306589e-01, 3.618281900060594802e-01], 
-[5.857020818056667653e-03, 9.040816326530612956e-01, 3.699556278222538852e-01], 
-[5.857020818056667653e-03, 9.061224489795918213e-01, 3.784302622572810471e-01], 
-[5.857020818056667653e-03, 9.081632653061224580e-01, 3.872748969636873317e-01], 
-[5.857020818056667653e-03, 9.102040816326530948e-01, 3.965143855963175756e-01], 
-[5.857020818056667653e-03, 9.122448979591837315e-01, 4.061758680484308104e-01], 
-[5.857020818056667653e-03, 9.142857142857142572e-01, 4.162890401814436925e-01], 
-[5.857020818056667653e-03, 9.163265306122448939e-01, 4.268864627293563752e-01], 
-[5.857020818056667653e-03, 9.183673469387755306e-01, 4.380039161886328802e-01], 
-[5.857020818056667653e-03, 9.204081632653061673e-01, 4.496808098932256748e-01], 
-[5.857020818056667653e-03, 9.224489795918368040e-01, 4.619606551906995096e-01], 
-[5.857020818056667653e-03, 9.244897959183673297e-01, 4.748916147669448584e-01], 
-[5.857020818056667653e-03, 9.265306122448979664e-01, 4.885271428285608009e-01], 
-[5.857020818056667653e-03, 9.285714285714286031e-01, 5.029267341943854941e-01], 
-[5.857020818056667653e-03, 9.306122448979592399e-01, 5.181568045702719116e-01], 
-[5.857020818056667653e-03, 9.326530612244897656e-01, 5.342917296491438428e-01], 
-[5.857020818056667653e-03, 9.346938775510204023e-01, 5.514150775481958533e-01], 
-[5.857020818056667653e-03, 9.367346938775510390e-01, 5.696210779487540510e-01], 
-[5.857020818056667653e-03, 9.387755102040816757e-01, 5.890163827998504686e-01], 
-[5.857020818056667653e-03, 9.408163265306123124e-01, 6.097221884905186240e-01], 
-[5.857020818056667653e-03, 9.428571428571428381e-01, 6.318768092493858290e-01], 
-[5.857020818056667653e-03, 9.448979591836734748e-01, 6.556388179656809090e-01], 
-[5.857020818056667653e-03, 9.469387755102041115e-01, 6.811909061624078499e-01], 
-[5.857020818056667653e-03, 9.489795918367347483e-01, 7.087446631123097696e-01], 
-[5.857020818056667653e-03, 9.510204081632652739e-01, 7.385465403451871857e-01], 
-[5.857020818056667653e-03, 9.530612244897959107e-01, 7.708853598369138638e-01], 
-[5.857020818056667653e-03, 9.551020408163265474e-01, 8.061018536560302650e-01], 
-[5.857020818056667653e-03, 9.571428571428571841e-01, 8.446009075126500454e-01], 
-[5.857020818056667653e-03, 9.591836734693878208e-01, 8.868674479549261136e-01], 
-[5.857020818056667653e-03, 9.612244897959183465e-01, 9.334873061545729822e-01], 
-[5.857020818056667653e-03, 9.632653061224489832e-01, 9.851749798878852715e-01], 
-[5.857020818056667653e-03, 9.653061224489796199e-01, 1.042811113822217362e+00], 
-[5.857020818056667653e-03, 9.673469387755102566e-01, 1.107493919164705076e+00], 
-[5.857020818056667653e-03, 9.693877551020407823e-01, 1.180610990253248005e+00], 
-[5.857020818056667653e-03, 9.714285714285714191e-01, 1.263941641299989538e+00], 
-[5.857020818056667653e-03, 9.734693877551020558e-01, 1.359806074351963101e+00], 
-[5.857020818056667653e-03, 9.755102040816326925e-01, 1.471288489387683196e+00], 
-[5.857020818056667653e-03, 9.775510204081632182e-01, 1.602580827435891031e+00], 
-[5.857020818056667653e-03, 9.795918367346938549e-01, 1.759530924938246477e+00], 
-[5.857020818056667653e-03, 9.816326530612244916e-01, 1.950552784332113321e+00], 
-[5.857020818056667653e-03, 9.836734693877551283e-01, 2.188213185730607080e+00], 
-[5.857020818056667653e-03, 9.857142857142857650e-01, 2.492165178118645574e+00], 
-[5.857020818056667653e-03, 9.877551020408162907e-01, 2.894985737647567614e+00], 
-[5.857020818056667653e-03, 9.897959183673469274e-01, 3.454944947507882169e+00], 
-[5.857020818056667653e-03, 9.918367346938775642e-01, 4.287713197260480058e+00], 
-[5.857020818056667653e-03, 9.938775510204082009e-01, 5.660693990976087164e+00], 
-[5.857020818056667653e-03, 9.959183673469387266e-01, 8.366229190126709625e+00], 
-[5.857020818056667653e-03, 9.979591836734693633e-01, 1.628938274444509560e+01], 
-[5.857020818056667653e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[6.428073117284318835e-03, 1.000000000000000021e-03, 2.278016694016762184e-02], 
-[6.428073117284318835e-03, 1.148922311909569708e-03, 2.276685680739442413e-02], 
-[6.428073117284318835e-03, 1.320022478803632065e-03, 2.275402860715609182e-02], 
-[6.428073117284318835e-03, 1.516603278119670137e-03, 2.274175449120859754e-02], 
-[6.428073117284318835e-03, 1.742459344546885402e-03, 2.273011754401418200e-02], 
-[6.428073117284318835e-03, 2.001950418545241171e-03, 2.271921348078569797e-02], 
-[6.428073117284318835e-03, 2.300085503203331758e-03, 2.270915262230298326e-02], 
-[6.428073117284318835e-03, 2.642619553930058204e-03, 2.270006219575611273e-02], 
-[6.428073117284318835e-03, 3.036164567398761706e-03, 2.269208902057993221e-02], 
-[6.428073117284318835e-03, 3.488317214113704091e-03, 2.268540265080503174e-02], 
-[6.428073117284318835e-03, 4.007805478313466660e-03, 2.268019906054019597e-02], 
-[6.428073117284318835e-03, 4.604657135827751671e-03, 2.267670497840953286e-02], 
-[6.428073117284318835e-03, 5.290393322046124149e-03, 2.267518300076219046e-02], 
-[6.428073117284318835e-03, 6.078250926476181683e-03, 2.267593764410159168e-02], 
-[6.428073117284318835e-03, 6.983438106813499684e-03, 2.267932253568325646e-02], 
-[6.428073117284318835e-03, 8.023427854757562983e-03, 2.268574899133311840e-02], 
-[6.428073117284318835e-03, 9.218295280327699903e-03, 2.269569629346693262e-02], 
-[6.428073117284318835e-03, 1.059110512533918171e-02, 2.270972406571120789e-02], 
-[6.428073117284318835e-03, 1.216835698628199354e-02, 2.272848724938134057e-02], 
-[6.428073117284318835e-03, 1.398049684082008047e-02, 2.275275433029429542e-02], 
-[6.428073117284318835e-03, 1.606250475199945058e-02, 2.278342965409766580e-02], 
-[6.428073117284318835e-03, 1.845457009472566828e-02, 2.282158092135144062e-02], 
-[6.428073117284318835e-03, 2.120286733852943389e-02, 2.286847329381515997e-02], 
-[6.428073117284318835e-03, 2.436044736169515681e-02, 2.292561200404645561e-02], 
-[6.428073117284318835e-03, 2.798826150195019707e-02, 2.299479599018163650e-02], 
-[6.428073117284318835e-03, 3.215633811115024138e-02, 2.307818594547897395e-02], 
-[6.428073117284318835e-03, 3.694513432520856594e-02, 2.317839138047382563e-02], 
-[6.428073117284318835e-03, 4.244708914272822542e-02, 2.329858299534001004e-02], 
-[6.428073117284318835e-03, 4.876840779169493850e-02, 2.344263907923808607e-02], 
-[6.428073117284318835e-03, 5.603111182818285713e-02, 2.361533814037661272e-02], 
-[6.428073117284318835e-03, 6.437539454049952259e-02, 2.382261506701231421e-02], 
-[6.428073117284318835e-03, 7.396232712556144451e-02, 2.407190568407570341e-02], 
-[6.428073117284318835e-03, 8.497696787531199003e-02, 2.437261599049373936e-02], 
-[6.428073117284318835e-03, 9.763193439036874088e-02, 2.473676993346037023e-02], 
-[6.428073117284318835e-03, 1.121715077759858903e-01, 2.517991718681610730e-02], 
-[6.428073117284318835e-03, 1.288763480443681220e-01, 2.572242682397504060e-02], 
-[6.428073117284318835e-03, 1.480689117455977755e-01, 2.639136616972868887e-02], 
-[6.428073117284318835e-03, 1.701196764046864207e-01, 2.722328906296626536e-02], 
-[6.428073117284318835e-03, 1.954542919161802172e-01, 2.826847785323278670e-02], 
-[6.428073117284318835e-03, 2.245617969409859638e-01, 2.959758658636196804e-02], 
-[6.428073117284318835e-03, 2.580040589080049296e-01, 3.131240539481029012e-02], 
-[6.428073117284318835e-03, 2.964266198426381838e-01, 3.356402712935531440e-02], 
-[6.428073117284318835e-03, 3.405711573811430193e-01, 3.658505609865923131e-02], 
-[6.428073117284318835e-03, 3.912898015080607528e-01, 4.075029662995217211e-02], 
-[6.428073117284318835e-03, 4.495615833752782953e-01, 4.670024707191471058e-02], 
-[6.428073117284318835e-03, 5.165113337172515529e-01, 5.561890705020786085e-02], 
-[6.428073117284318835e-03, 5.934313956619206021e-01, 6.995023919874085450e-02], 
-[6.428073117284318835e-03, 6.818065710636164178e-01, 9.565294069700470969e-02], 
-[6.428073117284318835e-03, 7.833427819015473803e-01, 1.520267026915088082e-01], 
-[6.428073117284318835e-03, 9.000000000000000222e-01, 3.574223415460114350e-01], 
-[6.428073117284318835e-03, 9.020408163265306589e-01, 3.652951544804303730e-01], 
-[6.428073117284318835e-03, 9.040816326530612956e-01, 3.734971208380541974e-01], 
-[6.428073117284318835e-03, 9.061224489795918213e-01, 3.820493859714837459e-01], 
-[6.428073117284318835e-03, 9.081632653061224580e-01, 3.909749537109689088e-01], 
-[6.428073117284318835e-03, 9.102040816326530948e-01, 4.002988956446240643e-01], 
-[6.428073117284318835e-03, 9.122448979591837315e-01, 4.100485893784089342e-01], 
-[6.428073117284318835e-03, 9.142857142857142572e-01, 4.202539905740386716e-01], 
-[6.428073117284318835e-03, 9.163265306122448939e-01, 4.309479444937031056e-01], 
-[6.428073117284318835e-03, 9.183673469387755306e-01, 4.421665439196507674e-01], 
-[6.428073117284318835e-03, 9.204081632653061673e-01, 4.539495417171949820e-01], 
-[6.428073117284318835e-03, 9.224489795918368040e-01, 4.663408280402842054e-01], 
-[6.428073117284318835e-03, 9.244897959183673297e-01, 4.793889843280623730e-01], 
-[6.428073117284318835e-03, 9.265306122448979664e-01, 4.931479289245704889e-01], 
-[6.428073117284318835e-03, 9.285714285714286031e-01, 5.076776725239040555e-01], 
-[6.428073117284318835e-03, 9.306122448979592399e-01, 5.230452059007839605e-01], 
-[6.428073117284318835e-03, 9.326530612244897656e-01, 5.393255477988920799e-01], 
-[6.428073117284318835e-03, 9.346938775510204023e-01, 5.566029877759788302e-01], 
-[6.428073117284318835e-03, 9.367346938775510390e-01, 5.749725677315087324e-01], 
-[6.428073117284318835e-03, 9.387755102040816757e-01, 5.945418574329339734e-01], 
-[6.428073117284318835e-03, 9.408163265306123124e-01, 6.154330945244856910e-01], 
-[6.428073117284318835e-03, 9.428571428571428381e-01, 6.377857795191015366e-01], 
-[6.428073117284318835e-03, 9.448979591836734748e-01, 6.617598429265407756e-01], 
-[6.428073117284318835e-03, 9.469387755102041115e-01, 6.875395374984147878e-01], 
-[6.428073117284318835e-03, 9.489795918367347483e-01, 7.153382572252309224e-01], 
-[6.428073117284318835e-03, 9.510204081632652739e-01, 7.454045515191192184e-01], 
-[6.428073117284318835e-03, 9.530612244897959107e-01, 7.780296958071688529e-01], 
-[6.428073117284318835e-03, 9.551020408163265474e-01, 8.135573102980671045e-01], 
-[6.428073117284318835e-03, 9.571428571428571841e-01, 8.523957048510146794e-01], 
-[6.428073117284318835e-03, 9.591836734693878208e-01, 8.950338973389735386e-01], 
-[6.428073117284318835e-03, 9.612244897959183465e-01, 9.420626492682113717e-01], 
-[6.428073117284318835e-03, 9.632653061224489832e-01, 9.942024558206599139e-01], 
-[6.428073117284318835e-03, 9.653061224489796199e-01, 1.052341333204634966e+00], 
-[6.428073117284318835e-03, 9.673469387755102566e-01, 1.117586658365864016e+00], 
-[6.428073117284318835e-03, 9.693877551020407823e-01, 1.191337570493538056e+00], 
-[6.428073117284318835e-03, 9.714285714285714191e-01, 1.275388138567892682e+00], 
-[6.428073117284318835e-03, 9.734693877551020558e-01, 1.372077736149704519e+00], 
-[6.428073117284318835e-03, 9.755102040816326925e-01, 1.484515949860981010e+00], 
-[6.428073117284318835e-03, 9.775510204081632182e-01, 1.616929082210132318e+00], 
-[6.428073117284318835e-03, 9.795918367346938549e-01, 1.775212687707469650e+00], 
-[6.428073117284318835e-03, 9.816326530612244916e-01, 1.967849085367046502e+00], 
-[6.428073117284318835e-03, 9.836734693877551283e-01, 2.207506527110136396e+00], 
-[6.428073117284318835e-03, 9.857142857142857650e-01, 2.513995769496600197e+00], 
-[6.428073117284318835e-03, 9.877551020408162907e-01, 2.920153358267510768e+00], 
-[6.428073117284318835e-03, 9.897959183673469274e-01, 3.484709846603778693e+00], 
-[6.428073117284318835e-03, 9.918367346938775642e-01, 4.324240682354416165e+00], 
-[6.428073117284318835e-03, 9.938775510204082009e-01, 5.708215856037570646e+00], 
-[6.428073117284318835e-03, 9.959183673469387266e-01, 8.434998535646172968e+00], 
-[6.428073117284318835e-03, 9.979591836734693633e-01, 1.641838907471908016e+01], 
-[6.428073117284318835e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[7.054802310718645032e-03, 1.000000000000000021e-03, 2.302962025245036681e-02], 
-[7.054802310718645032e-03, 1.148922311909569708e-03, 2.301599355422590670e-02], 
-[7.054802310718645032e-03, 1.320022478803632065e-03, 2.300285378045200183e-02], 
-[7.054802310718645032e-03, 1.516603278119670137e-03, 2.299027382649541235e-02], 
-[7.054802310718645032e-03, 1.742459344546885402e-03, 2.297833763257411607e-02], 
-[7.054802310718645032e-03, 2.001950418545241171e-03, 2.296714189905875447e-02], 
-[7.054802310718645032e-03, 2.300085503203331758e-03, 2.295679808160708268e-02], 
-[7.054802310718645032e-03, 2.642619553930058204e-03, 2.294743471531088957e-02], 
-[7.054802310718645032e-03, 3.036164567398761706e-03, 2.293920012799828198e-02], 
-[7.054802310718645032e-03, 3.488317214113704091e-03, 2.293226561458938662e-02], 
-[7.054802310718645032e-03, 4.007805478313466660e-03, 2.292682916011849759e-02], 
-[7.054802310718645032e-03, 4.604657135827751671e-03, 2.292311981829986411e-02], 
-[7.054802310718645032e-03, 5.290393322046124149e-03, 2.292140287677469843e-02], 
-[7.054802310718645032e-03, 6.078250926476181683e-03, 2.292198597109899177e-02], 
-[7.054802310718645032e-03, 6.983438106813499684e-03, 2.292522634845365476e-02], 
-[7.054802310718645032e-03, 8.023427854757562983e-03, 2.293153953263170688e-02], 
-[7.054802310718645032e-03, 9.218295280327699903e-03, 2.294140970645558095e-02], 
-[7.054802310718645032e-03, 1.059110512533918171e-02, 2.295540221202755499e-02], 
-[7.054802310718645032e-03, 1.216835698628199354e-02, 2.297417867916948242e-02], 
-[7.054802310718645032e-03, 1.398049684082008047e-02, 2.299851543706870477e-02], 
-[7.054802310718645032e-03, 1.606250475199945058e-02, 2.302932605575679775e-02], 
-[7.054802310718645032e-03, 1.845457009472566828e-02, 2.306768911964375557e-02], 
-[7.054802310718645032e-03, 2.120286733852943389e-02, 2.311488267892527343e-02], 
-[7.054802310718645032e-03, 2.436044736169515681e-02, 2.317242729001438295e-02], 
-[7.054802310718645032e-03, 2.798826150195019707e-02, 2.324214019209459858e-02], 
-[7.054802310718645032e-03, 3.215633811115024138e-02, 2.332620404330779107e-02], 
-[7.054802310718645032e-03, 3.694513432520856594e-02, 2.342725486040674737e-02], 
-[7.054802310718645032e-03, 4.244708914272822542e-02, 2.354849552224337617e-02], 
-[7.054802310718645032e-03, 4.876840779169493850e-02, 2.369384364067594548e-02], 
-[7.054802310718645032e-03, 5.603111182818285713e-02, 2.386812612388104424e-02], 
-[7.054802310718645032e-03, 6.437539454049952259e-02, 2.407733790383997236e-02], 
-[7.054802310718645032e-03, 7.396232712556144451e-02, 2.432898993869213322e-02], 
-[7.054802310718645032e-03, 8.497696787531199003e-02, 2.463258313318476833e-02], 
-[7.054802310718645032e-03, 9.763193439036874088e-02, 2.500026256375538491e-02], 
-[7.054802310718645032e-03, 1.121715077759858903e-01, 2.544773427546994510e-02], 
-[7.054802310718645032e-03, 1.288763480443681220e-01, 2.599557177417570822e-02], 
-[7.054802310718645032e-03, 1.480689117455977755e-01, 2.667111344422679747e-02], 
-[7.054802310718645032e-03, 1.701196764046864207e-01, 2.751127828018485461e-02], 
-[7.054802310718645032e-03, 1.954542919161802172e-01, 2.856684953692640444e-02], 
-[7.054802310718645032e-03, 2.245617969409859638e-01, 2.990918291418345060e-02], 
-[7.054802310718645032e-03, 2.580040589080049296e-01, 3.164107585901178993e-02], 
-[7.054802310718645032e-03, 2.964266198426381838e-01, 3.391511049828593860e-02], 
-[7.054802310718645032e-03, 3.405711573811430193e-01, 3.696617348161855554e-02], 
-[7.054802310718645032e-03, 3.912898015080607528e-01, 4.117272765801801432e-02], 
-[7.054802310718645032e-03, 4.495615833752782953e-01, 4.718148562778725491e-02], 
-[7.054802310718645032e-03, 5.165113337172515529e-01, 5.618785239024967626e-02], 
-[7.054802310718645032e-03, 5.934313956619206021e-01, 7.065912885999466042e-02], 
-[7.054802310718645032e-03, 6.818065710636164178e-01, 9.661028767295004593e-02], 
-[7.054802310718645032e-03, 7.833427819015473803e-01, 1.535205229709869224e-01], 
-[7.054802310718645032e-03, 9.000000000000000222e-01, 3.608125554844232585e-01], 
-[7.054802310718645032e-03, 9.020408163265306589e-01, 3.687568050211117998e-01], 
-[7.054802310718645032e-03, 9.040816326530612956e-01, 3.770331172677688358e-01], 
-[7.054802310718645032e-03, 9.061224489795918213e-01, 3.856628211637991854e-01], 
-[7.054802310718645032e-03, 9.081632653061224580e-01, 3.946691200443393499e-01], 
-[7.054802310718645032e-03, 9.102040816326530948e-01, 4.040773026933055512e-01], 
-[7.054802310718645032e-03, 9.122448979591837315e-01, 4.139149836194124799e-01], 
-[7.054802310718645032e-03, 9.142857142857142572e-01, 4.242123773932608422e-01], 
-[7.054802310718645032e-03, 9.163265306122448939e-01, 4.350026128220109145e-01], 
-[7.054802310718645032e-03, 9.183673469387755306e-01, 4.463220938867229481e-01], 
-[7.054802310718645032e-03, 9.204081632653061673e-01, 4.582109157795068444e-01], 
-[7.054802310718645032e-03, 9.224489795918368040e-01, 4.707133461224424775e-01], 
-[7.054802310718645032e-03, 9.244897959183673297e-01, 4.838783836172008135e-01], 
-[7.054802310718645032e-03, 9.265306122448979664e-01, 4.977604090800484826e-01], 
-[7.054802310718645032e-03, 9.285714285714286031e-01, 5.124199472147253909e-01], 
-[7.054802310718645032e-03, 9.306122448979592399e-01, 5.279245617681884717e-01], 
-[7.054802310718645032e-03, 9.326530612244897656e-01, 5.443499121708721411e-01], 
-[7.054802310718645032e-03, 9.346938775510204023e-01, 5.617810067463191448e-01], 
-[7.054802310718645032e-03, 9.367346938775510390e-01, 5.803136965745796516e-01], 
-[7.054802310718645032e-03, 9.387755102040816757e-01, 6.000564657784330791e-01], 
-[7.054802310718645032e-03, 9.408163265306123124e-01, 6.211325892925558811e-01], 
-[7.054802310718645032e-03, 9.428571428571428381e-01, 6.436827493548715751e-01], 
-[7.054802310718645032e-03, 9.448979591836734748e-01, 6.678682288276094337e-01], 
-[7.054802310718645032e-03, 9.469387755102041115e-01, 6.938748355729124073e-01], 
-[7.054802310718645032e-03, 9.489795918367347483e-01, 7.219177611548008855e-01], 
-[7.054802310718645032e-03, 9.510204081632652739e-01, 7.522476444758428027e-01], 
-[7.054802310718645032e-03, 9.530612244897959107e-01, 7.851582044939291460e-01], 
-[7.054802310718645032e-03, 9.551020408163265474e-01, 8.209959377493187827e-01], 
-[7.054802310718645032e-03, 9.571428571428571841e-01, 8.601725640882824653e-01], 
-[7.054802310718645032e-03, 9.591836734693878208e-01, 9.031811755844084688e-01], 
-[7.054802310718645032e-03, 9.612244897959183465e-01, 9.506174431859071294e-01], 
-[7.054802310718645032e-03, 9.632653061224489832e-01, 1.003207833736962762e+00], 
-[7.054802310718645032e-03, 9.653061224489796199e-01, 1.061847702917977365e+00], 
-[7.054802310718645032e-03, 9.673469387755102566e-01, 1.127653552976294105e+00], 
-[7.054802310718645032e-03, 9.693877551020407823e-01, 1.202036016265854546e+00], 
-[7.054802310718645032e-03, 9.714285714285714191e-01, 1.286803849449755122e+00], 
-[7.054802310718645032e-03, 9.734693877551020558e-01, 1.384315509004090394e+00], 
-[7.054802310718645032e-03, 9.755102040816326925e-01, 1.497705848830997777e+00], 
-[7.054802310718645032e-03, 9.775510204081632182e-01, 1.631235368360836269e+00], 
-[7.054802310718645032e-03, 9.795918367346938549e-01, 1.790847107109208469e+00], 
-[7.054802310718645032e-03, 9.816326530612244916e-01, 1.985091359844449954e+00], 
-[7.054802310718645032e-03, 9.836734693877551283e-01, 2.226737332261532032e+00], 
-[7.054802310718645032e-03, 9.857142857142857650e-01, 2.535752662724958029e+00], 
-[7.054802310718645032e-03, 9.877551020408162907e-01, 2.945232068611681076e+00], 
-[7.054802310718645032e-03, 9.897959183673469274e-01, 3.514364012780892832e+00], 
-[7.054802310718645032e-03, 9.918367346938775642e-01, 4.360623779211068474e+00], 
-[7.054802310718645032e-03, 9.938775510204082009e-01, 5.755535376756879984e+00], 
-[7.054802310718645032e-03, 9.959183673469387266e-01, 8.503444796901440839e+00], 
-[7.054802310718645032e-03, 9.979591836734693633e-01, 1.654668848308070750e+01], 
-[7.054802310718645032e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[7.742636826811269413e-03, 1.000000000000000021e-03, 2.327942218582400649e-02], 
-[7.742636826811269413e-03, 1.148922311909569708e-03, 2.326547504799687111e-02], 
-[7.742636826811269413e-03, 1.320022478803632065e-03, 2.325201982768655348e-02], 
-[7.742636826811269413e-03, 1.516603278119670137e-03, 2.323913016396887687e-02], 
-[7.742636826811269413e-03, 1.742459344546885402e-03, 2.322689085290246397e-02], 
-[7.742636826811269413e-03, 2.001950418545241171e-03, 2.321539958017411476e-02], 
-[7.742636826811269413e-03, 2.300085503203331758e-03, 2.320476893637442306e-02], 
-[7.742636826811269413e-03, 2.642619553930058204e-03, 2.319512876462249962e-02], 
-[7.742636826811269413e-03, 3.036164567398761706e-03, 2.318662890124582529e-02], 
-[7.742636826811269413e-03, 3.488317214113704091e-03, 2.317944238215541991e-02], 
-[7.742636826811269413e-03, 4.007805478313466660e-03, 2.317376920340392249e-02], 
-[7.742636826811269413e-03, 4.604657135827751671e-03, 2.316984074387528139e-02], 
-[7.742636826811269413e-03, 5.290393322046124149e-03, 2.316792498256267652e-02], 
-[7.742636826811269413e-03, 6.078250926476181683e-03, 2.316833267410763064e-02], 
-[7.742636826811269413e-03, 6.983438106813499684e-03, 2.317142468561200763e-02], 
-[7.742636826811269413e-03, 8.023427854757562983e-03, 2.317762074878169237e-02], 
-[7.742636826811269413e-03, 9.218295280327699903e-03, 2.318740994672549224e-02], 
-[7.742636826811269413e-03, 1.059110512533918171e-02, 2.320136333981444657e-02], 
-[7.742636826811269413e-03, 1.216835698628199354e-02, 2.322014924605630276e-02], 
-[7.742636826811269413e-03, 1.398049684082008047e-02, 2.324455183754402937e-02], 
-[7.742636826811269413e-03, 1.606250475199945058e-02, 2.327549390801977869e-02], 
-[7.742636826811269413e-03, 1.845457009472566828e-02, 2.331406492483699411e-02], 
-[7.742636826811269413e-03, 2.120286733852943389e-02, 2.336155582538358699e-02], 
-[7.742636826811269413e-03, 2.436044736169515681e-02, 2.341950248824616054e-02], 
-[7.742636826811269413e-03, 2.798826150195019707e-02, 2.348974045137542863e-02], 
-[7.742636826811269413e-03, 3.215633811115024138e-02, 2.357447433476494297e-02], 
-[7.742636826811269413e-03, 3.694513432520856594e-02, 2.367636665729110773e-02], 
-[7.742636826811269413e-03, 4.244708914272822542e-02, 2.379865247096644987e-02], 
-[7.742636826811269413e-03, 4.876840779169493850e-02, 2.394528870286985120e-02], 
-[7.742636826811269413e-03, 5.603111182818285713e-02, 2.412115065094859456e-02], 
-[7.742636826811269413e-03, 6.437539454049952259e-02, 2.433229327689398827e-02], 
-[7.742636826811269413e-03, 7.396232712556144451e-02, 2.458630265262172487e-02], 
-[7.742636826811269413e-03, 8.497696787531199003e-02, 2.489277456148328641e-02], 
-[7.742636826811269413e-03, 9.763193439036874088e-02, 2.526397517061777787e-02], 
-[7.742636826811269413e-03, 1.121715077759858903e-01, 2.571576684106408744e-02], 
-[7.742636826811269413e-03, 1.288763480443681220e-01, 2.626892743081938458e-02], 
-[7.742636826811269413e-03, 1.480689117455977755e-01, 2.695106626538911615e-02], 
-[7.742636826811269413e-03, 1.701196764046864207e-01, 2.779946731740832316e-02], 
-[7.742636826811269413e-03, 1.954542919161802172e-01, 2.886541447559190857e-02], 
-[7.742636826811269413e-03, 2.245617969409859638e-01, 3.022096466931604650e-02], 
-[7.742636826811269413e-03, 2.580040589080049296e-01, 3.196992197990307372e-02], 
-[7.742636826811269413e-03, 2.964266198426381838e-01, 3.426635668498102111e-02], 
-[7.742636826811269413e-03, 3.405711573811430193e-01, 3.734743584152143414e-02], 
-[7.742636826811269413e-03, 3.912898015080607528e-01, 4.159527733526724447e-02], 
-[7.742636826811269413e-03, 4.495615833752782953e-01, 4.766280133571470373e-02], 
-[7.742636826811269413e-03, 5.165113337172515529e-01, 5.675680429174564251e-02], 
-[7.742636826811269413e-03, 5.934313956619206021e-01, 7.136789277368246753e-02], 
-[7.742636826811269413e-03, 6.818065710636164178e-01, 9.756722353309696394e-02], 
-[7.742636826811269413e-03, 7.833427819015473803e-01, 1.550131464209480447e-01], 
-[7.742636826811269413e-03, 9.000000000000000222e-01, 3.641976327745520825e-01], 
-[7.742636826811269413e-03, 9.020408163265306589e-01, 3.722131451443667083e-01], 
-[7.742636826811269413e-03, 9.040816326530612956e-01, 3.805636208565624790e-01], 
-[7.742636826811269413e-03, 9.061224489795918213e-01, 3.892705718234958923e-01], 
-[7.742636826811269413e-03, 9.081632653061224580e-01, 3.983574002136523462e-01], 
-[7.742636826811269413e-03, 9.102040816326530948e-01, 4.078496112706999632e-01], 
-[7.742636826811269413e-03, 9.122448979591837315e-01, 4.177750555977312596e-01], 
-[7.742636826811269413e-03, 9.142857142857142572e-01, 4.281642057845660987e-01], 
-[7.742636826811269413e-03, 9.163265306122448939e-01, 4.390504732020574230e-01], 
-[7.742636826811269413e-03, 9.183673469387755306e-01, 4.504705719452741230e-01], 
-[7.742636826811269413e-03, 9.204081632653061673e-01, 4.624649383309844541e-01], 
-[7.742636826811269413e-03, 9.224489795918368040e-01, 4.750782161138714654e-01], 
-[7.742636826811269413e-03, 9.244897959183673297e-01, 4.883598197704711041e-01], 
-[7.742636826811269413e-03, 9.265306122448979664e-01, 5.023645909275180621e-01], 
-[7.742636826811269413e-03, 9.285714285714286031e-01, 5.171535664366974094e-01], 
-[7.742636826811269413e-03, 9.306122448979592399e-01, 5.327948809250183659e-01], 
-[7.742636826811269413e-03, 9.326530612244897656e-01, 5.493648321507282883e-01], 
-[7.742636826811269413e-03, 9.346938775510204023e-01, 5.669491445341954261e-01], 
-[7.742636826811269413e-03, 9.367346938775510390e-01, 5.856444753051577301e-01], 
-[7.742636826811269413e-03, 9.387755102040816757e-01, 6.055602194863040078e-01], 
-[7.742636826811269413e-03, 9.408163265306123124e-01, 6.268206853468905049e-01], 
-[7.742636826811269413e-03, 9.428571428571428381e-01, 6.495677323008426374e-01], 
-[7.742636826811269413e-03, 9.448979591836734748e-01, 6.739639903068905813e-01], 
-[7.742636826811269413e-03, 9.469387755102041115e-01, 7.001968162338485513e-01], 
-[7.742636826811269413e-03, 9.489795918367347483e-01, 7.284831920918071191e-01], 
-[7.742636826811269413e-03, 9.510204081632652739e-01, 7.590758379018769375e-01], 
-[7.742636826811269413e-03, 9.530612244897959107e-01, 7.922709062562913740e-01], 
-[7.742636826811269413e-03, 9.551020408163265474e-01, 8.284177582471992096e-01], 
-[7.742636826811269413e-03, 9.571428571428571841e-01, 8.679315095810684610e-01], 
-[7.742636826811269413e-03, 9.591836734693878208e-01, 9.113093094510249514e-01], 
-[7.742636826811269413e-03, 9.612244897959183465e-01, 9.591517174079754460e-01], 
-[7.742636826811269413e-03, 9.632653061224489832e-01, 1.012191146281727239e+00], 
-[7.742636826811269413e-03, 9.653061224489796199e-01, 1.071330259240366622e+00], 
-[7.742636826811269413e-03, 9.673469387755102566e-01, 1.137694643504149727e+00], 
-[7.742636826811269413e-03, 9.693877551020407823e-01, 1.212706373045980168e+00], 
-[7.742636826811269413e-03, 9.714285714285714191e-01, 1.298188825312544425e+00], 
-[7.742636826811269413e-03, 9.734693877551020558e-01, 1.396519451347010943e+00], 
-[7.742636826811269413e-03, 9.755102040816326925e-01, 1.510858253311973876e+00], 
-[7.742636826811269413e-03, 9.775510204081632182e-01, 1.645499763485685385e+00], 
-[7.742636826811269413e-03, 9.795918367346938549e-01, 1.806434274025818354e+00], 
-[7.742636826811269413e-03, 9.816326530612244916e-01, 2.002279715680605587e+00], 
-[7.742636826811269413e-03, 9.836734693877551283e-01, 2.245905731517689574e+00], 
-[7.742636826811269413e-03, 9.857142857142857650e-01, 2.557436018611730866e+00], 
-[7.742636826811269413e-03, 9.877551020408162907e-01, 2.970222072689731263e+00], 
-[7.742636826811269413e-03, 9.897959183673469274e-01, 3.543907714818639754e+00], 
-[7.742636826811269413e-03, 9.918367346938775642e-01, 4.396862861689546875e+00], 
-[7.742636826811269413e-03, 9.938775510204082009e-01, 5.802653119224409295e+00], 
-[7.742636826811269413e-03, 9.959183673469387266e-01, 8.571568972574276302e+00], 
-[7.742636826811269413e-03, 9.979591836734693633e-01, 1.667428350986482144e+01], 
-[7.742636826811269413e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[8.497534359086447373e-03, 1.000000000000000021e-03, 2.352957298382615109e-02], 
-[8.497534359086447373e-03, 1.148922311909569708e-03, 2.351530152547419428e-02], 
-[8.497534359086447373e-03, 1.320022478803632065e-03, 2.350152697884735908e-02], 
-[8.497534359086447373e-03, 1.516603278119670137e-03, 2.348832372682761738e-02], 
-[8.497534359086447373e-03, 1.742459344546885402e-03, 2.347577742141537804e-02], 
-[8.497534359086447373e-03, 2.001950418545241171e-03, 2.346398673371736382e-02], 
-[8.497534359086447373e-03, 2.300085503203331758e-03, 2.345306538936309249e-02], 
-[8.497534359086447373e-03, 2.642619553930058204e-03, 2.344314453960487724e-02], 
-[8.497534359086447373e-03, 3.036164567398761706e-03, 2.343437552937326779e-02], 
-[8.497534359086447373e-03, 3.488317214113704091e-03, 2.342693313566875102e-02], 
-[8.497534359086447373e-03, 4.007805478313466660e-03, 2.342101936565195441e-02], 
-[8.497534359086447373e-03, 4.604657135827751671e-03, 2.341686792345243698e-02], 
-[8.497534359086447373e-03, 5.290393322046124149e-03, 2.341474947947107949e-02], 
-[8.497534359086447373e-03, 6.078250926476181683e-03, 2.341497790746296589e-02], 
-[8.497534359086447373e-03, 6.983438106813499684e-03, 2.341791769444096644e-02], 
-[8.497534359086447373e-03, 8.023427854757562983e-03, 2.342399277996307094e-02], 
-[8.497534359086447373e-03, 9.218295280327699903e-03, 2.343369714729666431e-02], 
-[8.497534359086447373e-03, 1.059110512533918171e-02, 2.344760757486582733e-02], 
-[8.497534359086447373e-03, 1.216835698628199354e-02, 2.346639906853355967e-02], 
-[8.497534359086447373e-03, 1.398049684082008047e-02, 2.349086364281386188e-02], 
-[8.497534359086447373e-03, 1.606250475199945058e-02, 2.352193331449631622e-02], 
-[8.497534359086447373e-03, 1.845457009472566828e-02, 2.356070843293431305e-02], 
-[8.497534359086447373e-03, 2.120286733852943389e-02, 2.360849282144657571e-02], 
-[8.497534359086447373e-03, 2.436044736169515681e-02, 2.366683767908348002e-02], 
-[8.497534359086447373e-03, 2.798826150195019707e-02, 2.373759684028182992e-02], 
-[8.497534359086447373e-03, 3.215633811115024138e-02, 2.382299688379637195e-02], 
-[8.497534359086447373e-03, 3.694513432520856594e-02, 2.392572682650826593e-02], 
-[8.497534359086447373e-03, 4.244708914272822542e-02, 2.404905388802543176e-02], 
-[8.497534359086447373e-03, 4.876840779169493850e-02, 2.419697430311559122e-02], 
-[8.497534359086447373e-03, 5.603111182818285713e-02, 2.437441174923289655e-02], 
-[8.497534359086447373e-03, 6.437539454049952259e-02, 2.458748120368298151e-02], 
-[8.497534359086447373e-03, 7.396232712556144451e-02, 2.484384383262536189e-02], 
-[8.497534359086447373e-03, 8.497696787531199003e-02, 2.515319027067620949e-02], 
-[8.497534359086447373e-03, 9.763193439036874088e-02, 2.552790773698000032e-02], 
-[8.497534359086447373e-03, 1.121715077759858903e-01, 2.598401485310209563e-02], 
-[8.497534359086447373e-03, 1.288763480443681220e-01, 2.654249374866044647e-02], 
-[8.497534359086447373e-03, 1.480689117455977755e-01, 2.723122457158595744e-02], 
-[8.497534359086447373e-03, 1.701196764046864207e-01, 2.808785609458173266e-02], 
-[8.497534359086447373e-03, 1.954542919161802172e-01, 2.916417256817845777e-02], 
-[8.497534359086447373e-03, 2.245617969409859638e-01, 3.053293172644578127e-02], 
-[8.497534359086447373e-03, 2.580040589080049296e-01, 3.229894360371623335e-02], 
-[8.497534359086447373e-03, 2.964266198426381838e-01, 3.461776550179720968e-02], 
-[8.497534359086447373e-03, 3.405711573811430193e-01, 3.772884294979239606e-02], 
-[8.497534359086447373e-03, 3.912898015080607528e-01, 4.201794538301397569e-02], 
-[8.497534359086447373e-03, 4.495615833752782953e-01, 4.814419385519841388e-02], 
-[8.497534359086447373e-03, 5.165113337172515529e-01, 5.732576233865484261e-02], 
-[8.497534359086447373e-03, 5.934313956619206021e-01, 7.207653043766090728e-02], 
-[8.497534359086447373e-03, 6.818065710636164178e-01, 9.852374771210081761e-02], 
-[8.497534359086447373e-03, 7.833427819015473803e-01, 1.565045726774265122e-01], 
-[8.497534359086447373e-03, 9.000000000000000222e-01, 3.675775767210130995e-01], 
-[8.497534359086447373e-03, 9.020408163265306589e-01, 3.756641783696081927e-01], 
-[8.497534359086447373e-03, 9.040816326530612956e-01, 3.840886353526774544e-01], 
-[8.497534359086447373e-03, 9.061224489795918213e-01, 3.928726419428341110e-01], 
-[8.497534359086447373e-03, 9.081632653061224580e-01, 4.020397984716547191e-01], 
-[8.497534359086447373e-03, 9.102040816326530948e-01, 4.116158259079234494e-01], 
-[8.497534359086447373e-03, 9.122448979591837315e-01, 4.216288101423032453e-01], 
-[8.497534359086447373e-03, 9.142857142857142572e-01, 4.321094808959077271e-01], 
-[8.497534359086447373e-03, 9.163265306122448939e-01, 4.430915311239461696e-01], 
-[8.497534359086447373e-03, 9.183673469387755306e-01, 4.546119839528584006e-01], 
-[8.497534359086447373e-03, 9.204081632653061673e-01, 4.667116156243574787e-01], 
-[8.497534359086447373e-03, 9.224489795918368040e-01, 4.794354446929209868e-01], 
-[8.497534359086447373e-03, 9.244897959183673297e-01, 4.928332999253491331e-01], 
-[8.497534359086447373e-03, 9.265306122448979664e-01, 5.069604821005394557e-01], 
-[8.497534359086447373e-03, 9.285714285714286031e-01, 5.218785383603343764e-01], 
-[8.497534359086447373e-03, 9.306122448979592399e-01, 5.376561721240494807e-01], 
-[8.497534359086447373e-03, 9.326530612244897656e-01, 5.543703171238680838e-01], 
-[8.497534359086447373e-03, 9.346938775510204023e-01, 5.721074112138038181e-01], 
-[8.497534359086447373e-03, 9.367346938775510390e-01, 5.909649147490320109e-01], 
-[8.497534359086447373e-03, 9.387755102040816757e-01, 6.110531302043937796e-01], 
-[8.497534359086447373e-03, 9.408163265306123124e-01, 6.324973952367348717e-01], 
-[8.497534359086447373e-03, 9.428571428571428381e-01, 6.554407418973229316e-01], 
-[8.497534359086447373e-03, 9.448979591836734748e-01, 6.800471419974920551e-01], 
-[8.497534359086447373e-03, 9.469387755102041115e-01, 7.065054953230609502e-01], 
-[8.497534359086447373e-03, 9.489795918367347483e-01, 7.350345672195278679e-01], 
-[8.497534359086447373e-03, 9.510204081632652739e-01, 7.658891504746163648e-01], 
-[8.497534359086447373e-03, 9.530612244897959107e-01, 7.993678214423527439e-01], 
-[8.497534359086447373e-03, 9.551020408163265474e-01, 8.358227940159448366e-01], 
-[8.497534359086447373e-03, 9.571428571428571841e-01, 8.756725656702580851e-01], 
-[8.497534359086447373e-03, 9.591836734693878208e-01, 9.194183256798933446e-01], 
-[8.497534359086447373e-03, 9.612244897959183465e-01, 9.676655014124675436e-01], 
-[8.497534359086447373e-03, 9.632653061224489832e-01, 1.021152426073411945e+00], 
-[8.497534359086447373e-03, 9.653061224489796199e-01, 1.080789038418411785e+00], 
-[8.497534359086447373e-03, 9.673469387755102566e-01, 1.147709970419986902e+00], 
-[8.497534359086447373e-03, 9.693877551020407823e-01, 1.223348686264696283e+00], 
-[8.497534359086447373e-03, 9.714285714285714191e-01, 1.309543117469114559e+00], 
-[8.497534359086447373e-03, 9.734693877551020558e-01, 1.408689621544898518e+00], 
-[8.497534359086447373e-03, 9.755102040816326925e-01, 1.523973230238372611e+00], 
-[8.497534359086447373e-03, 9.775510204081632182e-01, 1.659722345084224226e+00], 
-[8.497534359086447373e-03, 9.795918367346938549e-01, 1.821974279217516424e+00], 
-[8.497534359086447373e-03, 9.816326530612244916e-01, 2.019414260637529157e+00], 
-[8.497534359086447373e-03, 9.836734693877551283e-01, 2.265011855013074005e+00], 
-[8.497534359086447373e-03, 9.857142857142857650e-01, 2.579045997703541815e+00], 
-[8.497534359086447373e-03, 9.877551020408162907e-01, 2.995123574156058233e+00], 
-[8.497534359086447373e-03, 9.897959183673469274e-01, 3.573341220992433342e+00], 
-[8.497534359086447373e-03, 9.918367346938775642e-01, 4.432958302888164503e+00], 
-[8.497534359086447373e-03, 9.938775510204082009e-01, 5.849569648264753674e+00], 
-[8.497534359086447373e-03, 9.959183673469387266e-01, 8.639372058837592405e+00], 
-[8.497534359086447373e-03, 9.979591836734693633e-01, 1.680117668785705121e+01], 
-[8.497534359086447373e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[9.326033468832199691e-03, 1.000000000000000021e-03, 2.378007289006558653e-02], 
-[9.326033468832199691e-03, 1.148922311909569708e-03, 2.376547322349185920e-02], 
-[9.326033468832199691e-03, 1.320022478803632065e-03, 2.375137546398504301e-02], 
-[9.326033468832199691e-03, 1.516603278119670137e-03, 2.373785473832914009e-02], 
-[9.326033468832199691e-03, 1.742459344546885402e-03, 2.372499755456609905e-02], 
-[9.326033468832199691e-03, 2.001950418545241171e-03, 2.371290356932476487e-02], 
-[9.326033468832199691e-03, 2.300085503203331758e-03, 2.370168764337778761e-02], 
-[9.326033468832199691e-03, 2.642619553930058204e-03, 2.369148223621448529e-02], 
-[9.326033468832199691e-03, 3.036164567398761706e-03, 2.368244020146972537e-02], 
-[9.326033468832199691e-03, 3.488317214113704091e-03, 2.367473805732931563e-02], 
-[9.326033468832199691e-03, 4.007805478313466660e-03, 2.366857982214831679e-02], 
-[9.326033468832199691e-03, 4.604657135827751671e-03, 2.366420152537413238e-02], 
-[9.326033468832199691e-03, 5.290393322046124149e-03, 2.366187652886690002e-02], 
-[9.326033468832199691e-03, 6.078250926476181683e-03, 2.366192182551846851e-02], 
-[9.326033468832199691e-03, 6.983438106813499684e-03, 2.366470552223707419e-02], 
-[9.326033468832199691e-03, 8.023427854757562983e-03, 2.367065576636562252e-02], 
-[9.326033468832199691e-03, 9.218295280327699903e-03, 2.368027144119484381e-02], 
-[9.326033468832199691e-03, 1.059110512533918171e-02, 2.369413504297736284e-02], 
-[9.326033468832199691e-03, 1.216835698628199354e-02, 2.371292826509069362e-02], 
-[9.326033468832199691e-03, 1.398049684082008047e-02, 2.373745096397769302e-02], 
-[9.326033468832199691e-03, 1.606250475199945058e-02, 2.376864437878579983e-02], 
-[9.326033468832199691e-03, 1.845457009472566828e-02, 2.380761973992135197e-02], 
-[9.326033468832199691e-03, 2.120286733852943389e-02, 2.385569375534925263e-02], 
-[9.326033468832199691e-03, 2.436044736169515681e-02, 2.391443294285439114e-02], 
-[9.326033468832199691e-03, 2.798826150195019707e-02, 2.398570943103821296e-02], 
-[9.326033468832199691e-03, 3.215633811115024138e-02, 2.407177175432060126e-02], 
-[9.326033468832199691e-03, 3.694513432520856594e-02, 2.417533542340635083e-02], 
-[9.326033468832199691e-03, 4.244708914272822542e-02, 2.429969981989983999e-02], 
-[9.326033468832199691e-03, 4.876840779169493850e-02, 2.444890047866893346e-02], 
-[9.326033468832199691e-03, 5.603111182818285713e-02, 2.462790944634452028e-02], 
-[9.326033468832199691e-03, 6.437539454049952259e-02, 2.484290170166965003e-02], 
-[9.326033468832199691e-03, 7.396232712556144451e-02, 2.510161348541562268e-02], 
-[9.326033468832199691e-03, 8.497696787531199003e-02, 2.541383025600125328e-02], 
-[9.326033468832199691e-03, 9.763193439036874088e-02, 2.579206024572278794e-02], 
-[9.326033468832199691e-03, 1.121715077759858903e-01, 2.625247828103534353e-02], 
-[9.326033468832199691e-03, 1.288763480443681220e-01, 2.681627068240170428e-02], 
-[9.326033468832199691e-03, 1.480689117455977755e-01, 2.751158830113815609e-02], 
-[9.326033468832199691e-03, 1.701196764046864207e-01, 2.837644453160485802e-02], 
-[9.326033468832199691e-03, 1.954542919161802172e-01, 2.946312371359698437e-02], 
-[9.326033468832199691e-03, 2.245617969409859638e-01, 3.084508396023163956e-02], 
-[9.326033468832199691e-03, 2.580040589080049296e-01, 3.262814057667341727e-02], 
-[9.326033468832199691e-03, 2.964266198426381838e-01, 3.496933676110696582e-02], 
-[9.326033468832199691e-03, 3.405711573811430193e-01, 3.811039457791090546e-02], 
-[9.326033468832199691e-03, 3.912898015080607528e-01, 4.244073152268738880e-02], 
-[9.326033468832199691e-03, 4.495615833752782953e-01, 4.862566284594963678e-02], 
-[9.326033468832199691e-03, 5.165113337172515529e-01, 5.789472611530141477e-02], 
-[9.326033468832199691e-03, 5.934313956619206021e-01, 7.278504135041982681e-02], 
-[9.326033468832199691e-03, 6.818065710636164178e-01, 9.947985964575113693e-02], 
-[9.326033468832199691e-03, 7.833427819015473803e-01, 1.579948013786139360e-01], 
-[9.326033468832199691e-03, 9.000000000000000222e-01, 3.709523906316175013e-01], 
-[9.326033468832199691e-03, 9.020408163265306589e-01, 3.791099082193830627e-01], 
-[9.326033468832199691e-03, 9.040816326530612956e-01, 3.876081645074158089e-01], 
-[9.326033468832199691e-03, 9.061224489795918213e-01, 3.964690355170487623e-01], 
-[9.326033468832199691e-03, 9.081632653061224580e-01, 4.057163190739687675e-01], 
-[9.326033468832199691e-03, 9.102040816326530948e-01, 4.153759511388536163e-01], 
-[9.326033468832199691e-03, 9.122448979591837315e-01, 4.254762520846949725e-01], 
-[9.326033468832199691e-03, 9.142857142857142572e-01, 4.360482078777166981e-01], 
-[9.326033468832199691e-03, 9.163265306122448939e-01, 4.471257920800854602e-01], 
-[9.326033468832199691e-03, 9.183673469387755306e-01, 4.587463357691383137e-01], 
-[9.326033468832199691e-03, 9.204081632653061673e-01, 4.709509539142406331e-01], 
-[9.326033468832199691e-03, 9.224489795918368040e-01, 4.837850385395721653e-01], 
-[9.326033468832199691e-03, 9.244897959183673297e-01, 4.972988312206519934e-01], 
-[9.326033468832199691e-03, 9.265306122448979664e-01, 5.115480902336869695e-01], 
-[9.326033468832199691e-03, 9.285714285714286031e-01, 5.265948711567908225e-01], 
-[9.326033468832199691e-03, 9.306122448979592399e-01, 5.425084441182770334e-01], 
-[9.326033468832199691e-03, 9.326530612244897656e-01, 5.593663764754379653e-01], 
-[9.326033468832199691e-03, 9.346938775510204023e-01, 5.772558168585341098e-01], 
-[9.326033468832199691e-03, 9.367346938775510390e-01, 5.962750257305624579e-01], 
-[9.326033468832199691e-03, 9.387755102040816757e-01, 6.165352095784129016e-01], 
-[9.326033468832199691e-03, 9.408163265306123124e-01, 6.381627315083894247e-01], 
-[9.326033468832199691e-03, 9.428571428571428381e-01, 6.613017916807522045e-01], 
-[9.326033468832199691e-03, 9.448979591836734748e-01, 6.861176985275962981e-01], 
-[9.326033468832199691e-03, 9.469387755102041115e-01, 7.128008886762473573e-01], 
-[9.326033468832199691e-03, 9.489795918367347483e-01, 7.415719037137024072e-01], 
-[9.326033468832199691e-03, 9.510204081632652739e-01, 7.726876008622998171e-01], 
-[9.326033468832199691e-03, 9.530612244897959107e-01, 8.064489703891812855e-01], 
-[9.326033468832199691e-03, 9.551020408163265474e-01, 8.432110672665797946e-01], 
-[9.326033468832199691e-03, 9.571428571428571841e-01, 8.833957566809762518e-01], 
-[9.326033468832199691e-03, 9.591836734693878208e-01, 9.275082509933255670e-01], 
-[9.326033468832199691e-03, 9.612244897959183465e-01, 9.761588246551364811e-01], 
-[9.326033468832199691e-03, 9.632653061224489832e-01, 1.030091705703970906e+00], 
-[9.326033468832199691e-03, 9.653061224489796199e-01, 1.090224076667179798e+00], 
-[9.326033468832199691e-03, 9.673469387755102566e-01, 1.157699574156744182e+00], 
-[9.326033468832199691e-03, 9.693877551020407823e-01, 1.233963001307763374e+00], 
-[9.326033468832199691e-03, 9.714285714285714191e-01, 1.320866777178193008e+00], 
-[9.326033468832199691e-03, 9.734693877551020558e-01, 1.420826077898726947e+00], 
-[9.326033468832199691e-03, 9.755102040816326925e-01, 1.537050846464897980e+00], 
-[9.326033468832199691e-03, 9.775510204081632182e-01, 1.673903190557888720e+00], 
-[9.326033468832199691e-03, 9.795918367346938549e-01, 1.837467213322427240e+00], 
-[9.326033468832199691e-03, 9.816326530612244916e-01, 2.036495102323113926e+00], 
-[9.326033468832199691e-03, 9.836734693877551283e-01, 2.284055832683870690e+00], 
-[9.326033468832199691e-03, 9.857142857142857650e-01, 2.600582760285877981e+00], 
-[9.326033468832199691e-03, 9.877551020408162907e-01, 3.019936776310186310e+00], 
-[9.326033468832199691e-03, 9.897959183673469274e-01, 3.602664799074307922e+00], 
-[9.326033468832199691e-03, 9.918367346938775642e-01, 4.468910475145523975e+00], 
-[9.326033468832199691e-03, 9.938775510204082009e-01, 5.896285527438879903e+00], 
-[9.326033468832199691e-03, 9.959183673469387266e-01, 8.706855049360477494e+00], 
-[9.326033468832199691e-03, 9.979591836734693633e-01, 1.692737054231293925e+01], 
-[9.326033468832199691e-03, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.023531021899026262e-02, 1.000000000000000021e-03, 2.403092214822227096e-02], 
-[1.023531021899026262e-02, 1.148922311909569708e-03, 2.401599037895089939e-02], 
-[1.023531021899026262e-02, 1.320022478803632065e-03, 2.400156551321319665e-02], 
-[1.023531021899026262e-02, 1.516603278119670137e-03, 2.398772342178984510e-02], 
-[1.023531021899026262e-02, 1.742459344546885402e-03, 2.397455146886269539e-02], 
-[1.023531021899026262e-02, 2.001950418545241171e-03, 2.396215029668327667e-02], 
-[1.023531021899026262e-02, 2.300085503203331758e-03, 2.395063590126980321e-02], 
-[1.023531021899026262e-02, 2.642619553930058204e-03, 2.394014205045026655e-02], 
-[1.023531021899026262e-02, 3.036164567398761706e-03, 2.393082310666273804e-02], 
-[1.023531021899026262e-02, 3.488317214113704091e-03, 2.392285732937135881e-02], 
-[1.023531021899026262e-02, 4.007805478313466660e-03, 2.391645074820892419e-02], 
-[1.023531021899026262e-02, 4.604657135827751671e-03, 2.391184171800930791e-02], 
-[1.023531021899026262e-02, 5.290393322046124149e-03, 2.390930629213917566e-02], 
-[1.023531021899026262e-02, 6.078250926476181683e-03, 2.390916458264550487e-02], 
-[1.023531021899026262e-02, 6.983438106813499684e-03, 2.391178831631073087e-02], 
-[1.023531021899026262e-02, 8.023427854757562983e-03, 2.391760984818897678e-02], 
-[1.023531021899026262e-02, 9.218295280327699903e-03, 2.392713296145153323e-02], 
-[1.023531021899026262e-02, 1.059110512533918171e-02, 2.394094586994641172e-02], 
-[1.023531021899026262e-02, 1.216835698628199354e-02, 2.395973695421479976e-02], 
-[1.023531021899026262e-02, 1.398049684082008047e-02, 2.398431391212443517e-02], 
-[1.023531021899026262e-02, 1.606250475199945058e-02, 2.401562720447729046e-02], 
-[1.023531021899026262e-02, 1.845457009472566828e-02, 2.405479894176945632e-02], 
-[1.023531021899026262e-02, 2.120286733852943389e-02, 2.410315871530845783e-02], 
-[1.023531021899026262e-02, 2.436044736169515681e-02, 2.416228835986197060e-02], 
-[1.023531021899026262e-02, 2.798826150195019707e-02, 2.423407829585082218e-02], 
-[1.023531021899026262e-02, 3.215633811115024138e-02, 2.432079901021984292e-02], 
-[1.023531021899026262e-02, 3.694513432520856594e-02, 2.442519250330228014e-02], 
-[1.023531021899026262e-02, 4.244708914272822542e-02, 2.455059031303250677e-02], 
-[1.023531021899026262e-02, 4.876840779169493850e-02, 2.470106726674568126e-02], 
-[1.023531021899026262e-02, 5.603111182818285713e-02, 2.488164376985092102e-02], 
-[1.023531021899026262e-02, 6.437539454049952259e-02, 2.509855478827085346e-02], 
-[1.023531021899026262e-02, 7.396232712556144451e-02, 2.535961161765672503e-02], 
-[1.023531021899026262e-02, 8.497696787531199003e-02, 2.567469451264231539e-02], 
-[1.023531021899026262e-02, 9.763193439036874088e-02, 2.605643267967528223e-02], 
-[1.023531021899026262e-02, 1.121715077759858903e-01, 2.652115709426305229e-02], 
-[1.023531021899026262e-02, 1.288763480443681220e-01, 2.709025818669443322e-02], 
-[1.023531021899026262e-02, 1.480689117455977755e-01, 2.779215739231715582e-02], 
-[1.023531021899026262e-02, 1.701196764046864207e-01, 2.866523254833229506e-02], 
-[1.023531021899026262e-02, 1.954542919161802172e-01, 2.976226781072030883e-02], 
-[1.023531021899026262e-02, 2.245617969409859638e-01, 3.115742124530564844e-02], 
-[1.023531021899026262e-02, 2.580040589080049296e-01, 3.295751274498684436e-02], 
-[1.023531021899026262e-02, 2.964266198426381838e-01, 3.532107027529866189e-02], 
-[1.023531021899026262e-02, 3.405711573811430193e-01, 3.849209049741152133e-02], 
-[1.023531021899026262e-02, 3.912898015080607528e-01, 4.286363547583188494e-02], 
-[1.023531021899026262e-02, 4.495615833752782953e-01, 4.910720796788944909e-02], 
-[1.023531021899026262e-02, 5.165113337172515529e-01, 5.846369520637435119e-02], 
-[1.023531021899026262e-02, 5.934313956619206021e-01, 7.349342501108205306e-02], 
-[1.023531021899026262e-02, 6.818065710636164178e-01, 1.004355587709708925e-01], 
-[1.023531021899026262e-02, 7.833427819015473803e-01, 1.594838321648561208e-01], 
-[1.023531021899026262e-02, 9.000000000000000222e-01, 3.743220778173589336e-01], 
-[1.023531021899026262e-02, 9.020408163265306589e-01, 3.825503382193577440e-01], 
-[1.023531021899026262e-02, 9.040816326530612956e-01, 3.911222120751255416e-01], 
-[1.023531021899026262e-02, 9.061224489795918213e-01, 4.000597565443341219e-01], 
-[1.023531021899026262e-02, 9.081632653061224580e-01, 4.093869662790760033e-01], 
-[1.023531021899026262e-02, 9.102040816326530948e-01, 4.191299915001117649e-01], 
-[1.023531021899026262e-02, 9.122448979591837315e-01, 4.293173862590853318e-01], 
-[1.023531021899026262e-02, 9.142857142857142572e-01, 4.399803918828850691e-01], 
-[1.023531021899026262e-02, 9.163265306122448939e-01, 4.511532615651720479e-01], 
-[1.023531021899026262e-02, 9.183673469387755306e-01, 4.628736332558678890e-01], 
-[1.023531021899026262e-02, 9.204081632653061673e-01, 4.751829594571150284e-01], 
-[1.023531021899026262e-02, 9.224489795918368040e-01, 4.881270043354168919e-01], 
-[1.023531021899026262e-02, 9.244897959183673297e-01, 5.017564207965193868e-01], 
-[1.023531021899026262e-02, 9.265306122448979664e-01, 5.161274229625278931e-01], 
-[1.023531021899026262e-02, 9.285714285714286031e-01, 5.313025729978426703e-01], 
-[1.023531021899026262e-02, 9.306122448979592399e-01, 5.473517056608925291e-01], 
-[1.023531021899026262e-02, 9.326530612244897656e-01, 5.643530195902999314e-01], 
-[1.023531021899026262e-02, 9.346938775510204023e-01, 5.823943715409445332e-01], 
-[1.023531021899026262e-02, 9.367346938775510390e-01, 6.015748190726567524e-01], 
-[1.023531021899026262e-02, 9.387755102040816757e-01, 6.220064692519109428e-01], 
-[1.023531021899026262e-02, 9.408163265306123124e-01, 6.438167067051860926e-01], 
-[1.023531021899026262e-02, 9.428571428571428381e-01, 6.671508951836782053e-01], 
-[1.023531021899026262e-02, 9.448979591836734748e-01, 6.921756745204348249e-01], 
-[1.023531021899026262e-02, 9.469387755102041115e-01, 7.190830121229381255e-01], 
-[1.023531021899026262e-02, 9.489795918367347483e-01, 7.480952187425026212e-01], 
-[1.023531021899026262e-02, 9.510204081632652739e-01, 7.794712077239820402e-01], 
-[1.023531021899026262e-02, 9.530612244897959107e-01, 8.135143734227875401e-01], 
-[1.023531021899026262e-02, 9.551020408163265474e-01, 8.505826001968906924e-01], 
-[1.023531021899026262e-02, 9.571428571428571841e-01, 8.911011069225595049e-01], 
-[1.023531021899026262e-02, 9.591836734693878208e-01, 9.355791120948511175e-01], 
-[1.023531021899026262e-02, 9.612244897959183465e-01, 9.846317165694148388e-01], 
-[1.023531021899026262e-02, 9.632653061224489832e-01, 1.039009017738831586e+00], 
-[1.023531021899026262e-02, 9.653061224489796199e-01, 1.099635410170175520e+00], 
-[1.023531021899026262e-02, 9.673469387755102566e-01, 1.167663495109721783e+00], 
-[1.023531021899026262e-02, 9.693877551020407823e-01, 1.244549363515906615e+00], 
-[1.023531021899026262e-02, 9.714285714285714191e-01, 1.332159855644376112e+00], 
-[1.023531021899026262e-02, 9.734693877551020558e-01, 1.432928878644011972e+00], 
-[1.023531021899026262e-02, 9.755102040816326925e-01, 1.550091168766501548e+00], 
-[1.023531021899026262e-02, 9.775510204081632182e-01, 1.688042377210042577e+00], 
-[1.023531021899026262e-02, 9.795918367346938549e-01, 1.852913166856654081e+00], 
-[1.023531021899026262e-02, 9.816326530612244916e-01, 2.053522348191159974e+00], 
-[1.023531021899026262e-02, 9.836734693877551283e-01, 2.303037794268151472e+00], 
-[1.023531021899026262e-02, 9.857142857142857650e-01, 2.622046466383338270e+00], 
-[1.023531021899026262e-02, 9.877551020408162907e-01, 3.044661882097182914e+00], 
-[1.023531021899026262e-02, 9.897959183673469274e-01, 3.631878716333595492e+00], 
-[1.023531021899026262e-02, 9.918367346938775642e-01, 4.504719750041743076e+00], 
-[1.023531021899026262e-02, 9.938775510204082009e-01, 5.942801319046417063e+00], 
-[1.023531021899026262e-02, 9.959183673469387266e-01, 8.774018935313463885e+00], 
-[1.023531021899026262e-02, 9.979591836734693633e-01, 1.705286759097764104e+01], 
-[1.023531021899026262e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.123324032978027624e-02, 1.000000000000000021e-03, 2.428212100204731744e-02], 
-[1.123324032978027624e-02, 1.148922311909569708e-03, 2.426685322881939194e-02], 
-[1.123324032978027624e-02, 1.320022478803632065e-03, 2.425209735670836447e-02], 
-[1.123324032978027624e-02, 1.516603278119670137e-03, 2.423793000058498126e-02], 
-[1.123324032978027624e-02, 1.742459344546885402e-03, 2.422443938086794174e-02], 
-[1.123324032978027624e-02, 2.001950418545241171e-03, 2.421172712553050499e-02], 
-[1.123324032978027624e-02, 2.300085503203331758e-03, 2.419991036593701142e-02], 
-[1.123324032978027624e-02, 2.642619553930058204e-03, 2.418912417835362982e-02], 
-[1.123324032978027624e-02, 3.036164567398761706e-03, 2.417952443411819016e-02], 
-[1.123324032978027624e-02, 3.488317214113704091e-03, 2.417129113406338639e-02], 
-[1.123324032978027624e-02, 4.007805478313466660e-03, 2.416463231917989618e-02], 
-[1.123324032978027624e-02, 4.604657135827751671e-03, 2.415978866975295944e-02], 
-[1.123324032978027624e-02, 5.290393322046124149e-03, 2.415703893069894373e-02], 
-[1.123324032978027624e-02, 6.078250926476181683e-03, 2.415670633323341310e-02], 
-[1.123324032978027624e-02, 6.983438106813499684e-03, 2.415916622398620039e-02], 
-[1.123324032978027624e-02, 8.023427854757562983e-03, 2.416485516564250563e-02], 
-[1.123324032978027624e-02, 9.218295280327699903e-03, 2.417428184110390760e-02], 
-[1.123324032978027624e-02, 1.059110512533918171e-02, 2.418804018157199448e-02], 
-[1.123324032978027624e-02, 1.216835698628199354e-02, 2.420682525439061053e-02], 
-[1.123324032978027624e-02, 1.398049684082008047e-02, 2.423145259833663426e-02], 
-[1.123324032978027624e-02, 1.606250475199945058e-02, 2.426288189514944071e-02], 
-[1.123324032978027624e-02, 1.845457009472566828e-02, 2.430224613443564968e-02], 
-[1.123324032978027624e-02, 2.120286733852943389e-02, 2.435088778952274047e-02], 
-[1.123324032978027624e-02, 2.436044736169515681e-02, 2.441040401038718430e-02], 
-[1.123324032978027624e-02, 2.798826150195019707e-02, 2.448270350689729993e-02], 
-[1.123324032978027624e-02, 3.215633811115024138e-02, 2.457007871535363611e-02], 
-[1.123324032978027624e-02, 3.694513432520856594e-02, 2.467529812147363152e-02], 
-[1.123324032978027624e-02, 4.244708914272822542e-02, 2.480172541383135476e-02], 
-[1.123324032978027624e-02, 4.876840779169493850e-02, 2.495347470452161445e-02], 
-[1.123324032978027624e-02, 5.603111182818285713e-02, 2.513561474727648432e-02], 
-[1.123324032978027624e-02, 6.437539454049952259e-02, 2.535444048085751939e-02], 
-[1.123324032978027624e-02, 7.396232712556144451e-02, 2.561783823596455040e-02], 
-[1.123324032978027624e-02, 8.497696787531199003e-02, 2.593578303573663979e-02], 
-[1.123324032978027624e-02, 9.763193439036874088e-02, 2.632102502161495078e-02], 
-[1.123324032978027624e-02, 1.121715077759858903e-01, 2.679005126213231808e-02], 
-[1.123324032978027624e-02, 1.288763480443681220e-01, 2.736445621613837684e-02], 
-[1.123324032978027624e-02, 1.480689117455977755e-01, 2.807293178334495723e-02], 
-[1.123324032978027624e-02, 1.701196764046864207e-01, 2.895422006457339104e-02], 
-[1.123324032978027624e-02, 1.954542919161802172e-01, 3.006160475838311197e-02], 
-[1.123324032978027624e-02, 2.245617969409859638e-01, 3.146994345627287387e-02], 
-[1.123324032978027624e-02, 2.580040589080049296e-01, 3.328705995485885250e-02], 
-[1.123324032978027624e-02, 2.964266198426381838e-01, 3.567296585677660892e-02], 
-[1.123324032978027624e-02, 3.405711573811430193e-01, 3.887393047988377259e-02], 
-[1.123324032978027624e-02, 3.912898015080607528e-01, 4.328665696410696762e-02], 
-[1.123324032978027624e-02, 4.495615833752782953e-01, 4.958882888114882204e-02], 
-[1.123324032978027624e-02, 5.165113337172515529e-01, 5.903266919692740089e-02], 
-[1.123324032978027624e-02, 5.934313956619206021e-01, 7.420168091940276822e-02], 
-[1.123324032978027624e-02, 6.818065710636164178e-01, 1.013908445258147883e-01], 
-[1.123324032978027624e-02, 7.833427819015473803e-01, 1.609716646786493732e-01], 
-[1.123324032978027624e-02, 9.000000000000000222e-01, 3.776866415923967324e-01], 
-[1.123324032978027624e-02, 9.020408163265306589e-01, 3.859854718983008470e-01], 
-[1.123324032978027624e-02, 9.040816326530612956e-01, 3.946307818131826739e-01], 
-[1.123324032978027624e-02, 9.061224489795918213e-01, 4.036448090258263344e-01], 
-[1.123324032978027624e-02, 9.081632653061224580e-01, 4.130517443482997209e-01], 
-[1.123324032978027624e-02, 9.102040816326530948e-01, 4.228779515310453485e-01], 
-[1.123324032978027624e-02, 9.122448979591837315e-01, 4.331522175022461951e-01], 
-[1.123324032978027624e-02, 9.142857142857142572e-01, 4.439060380667453343e-01], 
-[1.123324032978027624e-02, 9.163265306122448939e-01, 4.551739450761697614e-01], 
-[1.123324032978027624e-02, 9.183673469387755306e-01, 4.669938822768695541e-01], 
-[1.123324032978027624e-02, 9.204081632653061673e-01, 4.794076385113062444e-01], 
-[1.123324032978027624e-02, 9.224489795918368040e-01, 4.924613487636363418e-01], 
-[1.123324032978027624e-02, 9.244897959183673297e-01, 5.062060757943893652e-01], 
-[1.123324032978027624e-02, 9.265306122448979664e-01, 5.206984879235988517e-01], 
-[1.123324032978027624e-02, 9.285714285714286031e-01, 5.360016520558608111e-01], 
-[1.123324032978027624e-02, 9.306122448979592399e-01, 5.521859655052587801e-01], 
-[1.123324032978027624e-02, 9.326530612244897656e-01, 5.693302558530062285e-01], 
-[1.123324032978027624e-02, 9.346938775510204023e-01, 5.875230853327358949e-01], 
-[1.123324032978027624e-02, 9.367346938775510390e-01, 6.068643055967419819e-01], 
-[1.123324032978027624e-02, 9.387755102040816757e-01, 6.274669208662477793e-01], 
-[1.123324032978027624e-02, 9.408163265306123124e-01, 6.494593333674582025e-01], 
-[1.123324032978027624e-02, 9.428571428571428381e-01, 6.729880659347242666e-01], 
-[1.123324032978027624e-02, 9.448979591836734748e-01, 6.982210845942553590e-01], 
-[1.123324032978027624e-02, 9.469387755102041115e-01, 7.253518814864652331e-01], 
-[1.123324032978027624e-02, 9.489795918367347483e-01, 7.546045294665031378e-01], 
-[1.123324032978027624e-02, 9.510204081632652739e-01, 7.862399897095038170e-01], 
-[1.123324032978027624e-02, 9.530612244897959107e-01, 8.205640508580922532e-01], 
-[1.123324032978027624e-02, 9.551020408163265474e-01, 8.579374149913921999e-01], 
-[1.123324032978027624e-02, 9.571428571428571841e-01, 8.987886406885240431e-01], 
-[1.123324032978027624e-02, 9.591836734693878208e-01, 9.436309356691834349e-01], 
-[1.123324032978027624e-02, 9.612244897959183465e-01, 9.930842065663738616e-01], 
-[1.123324032978027624e-02, 9.632653061224489832e-01, 1.047904394716862475e+00], 
-[1.123324032978027624e-02, 9.653061224489796199e-01, 1.109023075079311527e+00], 
-[1.123324032978027624e-02, 9.673469387755102566e-01, 1.177601773636555382e+00], 
-[1.123324032978027624e-02, 9.693877551020407823e-01, 1.255107818184796553e+00], 
-[1.123324032978027624e-02, 9.714285714285714191e-01, 1.343422404018110194e+00], 
-[1.123324032978027624e-02, 9.734693877551020558e-01, 1.444998081950805258e+00], 
-[1.123324032978027624e-02, 9.755102040816326925e-01, 1.563094263838394671e+00], 
-[1.123324032978027624e-02, 9.775510204081632182e-01, 1.702139982245998606e+00], 
-[1.123324032978027624e-02, 9.795918367346938549e-01, 1.868312230214319136e+00], 
-[1.123324032978027624e-02, 9.816326530612244916e-01, 2.070496105541507870e+00], 
-[1.123324032978027624e-02, 9.836734693877551283e-01, 2.321957869306016331e+00], 
-[1.123324032978027624e-02, 9.857142857142857650e-01, 2.643437275759875416e+00], 
-[1.123324032978027624e-02, 9.877551020408162907e-01, 3.069299094108024484e+00], 
-[1.123324032978027624e-02, 9.897959183673469274e-01, 3.660983239537561662e+00], 
-[1.123324032978027624e-02, 9.918367346938775642e-01, 4.540386498399513471e+00], 
-[1.123324032978027624e-02, 9.938775510204082009e-01, 5.989117584127806815e+00], 
-[1.123324032978027624e-02, 9.959183673469387266e-01, 8.840864705373640220e+00], 
-[1.123324032978027624e-02, 9.979591836734693633e-01, 1.717767034410453064e+01], 
-[1.123324032978027624e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.232846739442066547e-02, 1.000000000000000021e-03, 2.453366969536294878e-02], 
-[1.232846739442066547e-02, 1.148922311909569708e-03, 2.451806201013248185e-02], 
-[1.232846739442066547e-02, 1.320022478803632065e-03, 2.450297122471000941e-02], 
-[1.232846739442066547e-02, 1.516603278119670137e-03, 2.448847469814861844e-02], 
-[1.232846739442066547e-02, 1.742459344546885402e-03, 2.447466150719939185e-02], 
-[1.232846739442066547e-02, 2.001950418545241171e-03, 2.446163426565472337e-02], 
-[1.232846739442066547e-02, 2.300085503203331758e-03, 2.444951124032379575e-02], 
-[1.232846739442066547e-02, 2.642619553930058204e-03, 2.443842881600846728e-02], 
-[1.232846739442066547e-02, 3.036164567398761706e-03, 2.442854437304033469e-02], 
-[1.232846739442066547e-02, 3.488317214113704091e-03, 2.442003965370819624e-02], 
-[1.232846739442066547e-02, 4.007805478313466660e-03, 2.441312471043752610e-02], 
-[1.232846739442066547e-02, 4.604657135827751671e-03, 2.440804254902620429e-02], 
-[1.232846739442066547e-02, 5.290393322046124149e-03, 2.440507460597923783e-02], 
-[1.232846739442066547e-02, 6.078250926476181683e-03, 2.440454723168943019e-02], 
-[1.232846739442066547e-02, 6.983438106813499684e-03, 2.440683939260156546e-02], 
-[1.232846739442066547e-02, 8.023427854757562983e-03, 2.441239185894537173e-02], 
-[1.232846739442066547e-02, 9.218295280327699903e-03, 2.442171821319489428e-02], 
-[1.232846739442066547e-02, 1.059110512533918171e-02, 2.443541810365478656e-02], 
-[1.232846739442066547e-02, 1.216835698628199354e-02, 2.445419328410047832e-02], 
-[1.232846739442066547e-02, 1.398049684082008047e-02, 2.447886713369043510e-02], 
-[1.232846739442066547e-02, 1.606250475199945058e-02, 2.451040855437059546e-02], 
-[1.232846739442066547e-02, 1.845457009472566828e-02, 2.454996141386261987e-02], 
-[1.232846739442066547e-02, 2.120286733852943389e-02, 2.459888106617245593e-02], 
-[1.232846739442066547e-02, 2.436044736169515681e-02, 2.465877997468889776e-02], 
-[1.232846739442066547e-02, 2.798826150195019707e-02, 2.473158513632942382e-02], 
-[1.232846739442066547e-02, 3.215633811115024138e-02, 2.481961093354951436e-02], 
-[1.232846739442066547e-02, 3.694513432520856594e-02, 2.492565233317107359e-02], 
-[1.232846739442066547e-02, 4.244708914272822542e-02, 2.505310516866204873e-02], 
-[1.232846739442066547e-02, 4.876840779169493850e-02, 2.520612282913413382e-02], 
-[1.232846739442066547e-02, 5.603111182818285713e-02, 2.538982240610247743e-02], 
-[1.232846739442066547e-02, 6.437539454049952259e-02, 2.561055879675463998e-02], 
-[1.232846739442066547e-02, 7.396232712556144451e-02, 2.587629334690664390e-02], 
-[1.232846739442066547e-02, 8.497696787531199003e-02, 2.619709582036991447e-02], 
-[1.232846739442066547e-02, 9.763193439036874088e-02, 2.658583725426765312e-02], 
-[1.232846739442066547e-02, 1.121715077759858903e-01, 2.705916075393809822e-02], 
-[1.232846739442066547e-02, 1.288763480443681220e-01, 2.763886472528177818e-02], 
-[1.232846739442066547e-02, 1.480689117455977755e-01, 2.835391141239422541e-02], 
-[1.232846739442066547e-02, 1.701196764046864207e-01, 2.924340700009232102e-02], 
-[1.232846739442066547e-02, 1.954542919161802172e-01, 3.036113445538199743e-02], 
-[1.232846739442066547e-02, 2.245617969409859638e-01, 3.178265046771144853e-02], 
-[1.232846739442066547e-02, 2.580040589080049296e-01, 3.361678205248197493e-02], 
-[1.232846739442066547e-02, 2.964266198426381838e-01, 3.602502331796111901e-02], 
-[1.232846739442066547e-02, 3.405711573811430193e-01, 3.925591429697234541e-02], 
-[1.232846739442066547e-02, 3.912898015080607528e-01, 4.370979570928733293e-02], 
-[1.232846739442066547e-02, 4.495615833752782953e-01, 5.007052524606846189e-02], 
-[1.232846739442066547e-02, 5.165113337172515529e-01, 5.960164767237886851e-02], 
-[1.232846739442066547e-02, 5.934313956619206021e-01, 7.490980857576913510e-02], 
-[1.232846739442066547e-02, 6.818065710636164178e-01, 1.023457163494685962e-01], 
-[1.232846739442066547e-02, 7.833427819015473803e-01, 1.624582985646373379e-01], 
-[1.232846739442066547e-02, 9.000000000000000222e-01, 3.810460852740426008e-01], 
-[1.232846739442066547e-02, 9.020408163265306589e-01, 3.894153127880697896e-01], 
-[1.232846739442066547e-02, 9.040816326530612956e-01, 3.981338774819774273e-01], 
-[1.232846739442066547e-02, 9.061224489795918213e-01, 4.072241969655882032e-01], 
-[1.232846739442066547e-02, 9.081632653061224580e-01, 4.167106575457886208e-01], 
-[1.232846739442066547e-02, 9.102040816326530948e-01, 4.266198357737112090e-01], 
-[1.232846739442066547e-02, 9.122448979591837315e-01, 4.369807506535252073e-01], 
-[1.232846739442066547e-02, 9.142857142857142572e-01, 4.478251515870538269e-01], 
-[1.232846739442066547e-02, 9.163265306122448939e-01, 4.591878481122915190e-01], 
-[1.232846739442066547e-02, 9.183673469387755306e-01, 4.711070886980181505e-01], 
-[1.232846739442066547e-02, 9.204081632653061673e-01, 4.836249973369656230e-01], 
-[1.232846739442066547e-02, 9.224489795918368040e-01, 4.967880785089812123e-01], 
-[1.232846739442066547e-02, 9.244897959183673297e-01, 5.106478033569787911e-01], 
-[1.232846739442066547e-02, 9.265306122448979664e-01, 5.252612927543858223e-01], 
-[1.232846739442066547e-02, 9.285714285714286031e-01, 5.406921165037910093e-01], 
-[1.232846739442066547e-02, 9.306122448979592399e-01, 5.570112324048890340e-01], 
-[1.232846739442066547e-02, 9.326530612244897656e-01, 5.742980946477760362e-01], 
-[1.232846739442066547e-02, 9.346938775510204023e-01, 5.926419683047290388e-01], 
-[1.232846739442066547e-02, 9.367346938775510390e-01, 6.121434961227425475e-01], 
-[1.232846739442066547e-02, 9.387755102040816757e-01, 6.329165760605705016e-01], 
-[1.232846739442066547e-02, 9.408163265306123124e-01, 6.550906240325158336e-01], 
-[1.232846739442066547e-02, 9.428571428571428381e-01, 6.788133174585664342e-01], 
-[1.232846739442066547e-02, 9.448979591836734748e-01, 7.042539433622991840e-01], 
-[1.232846739442066547e-02, 9.469387755102041115e-01, 7.316075125839368587e-01], 
-[1.232846739442066547e-02, 9.489795918367347483e-01, 7.610998530386530181e-01], 
-[1.232846739442066547e-02, 9.510204081632652739e-01, 7.929939654594624354e-01], 
-[1.232846739442066547e-02, 9.530612244897959107e-01, 8.275980229988991743e-01], 
-[1.232846739442066547e-02, 9.551020408163265474e-01, 8.652755338213014014e-01], 
-[1.232846739442066547e-02, 9.571428571428571841e-01, 9.064583822565381865e-01], 
-[1.232846739442066547e-02, 9.591836734693878208e-01, 9.516637483821941412e-01], 
-[1.232846739442066547e-02, 9.612244897959183465e-01, 1.001516324034727567e+00], 
-[1.232846739442066547e-02, 9.632653061224489832e-01, 1.056777869150350213e+00], 
-[1.232846739442066547e-02, 9.653061224489796199e-01, 1.118387107514889678e+00], 
-[1.232846739442066547e-02, 9.673469387755102566e-01, 1.187514450057200577e+00], 
-[1.232846739442066547e-02, 9.693877551020407823e-01, 1.265638410565035343e+00], 
-[1.232846739442066547e-02, 9.714285714285714191e-01, 1.354654473395690450e+00], 
-[1.232846739442066547e-02, 9.734693877551020558e-01, 1.457033745923699053e+00], 
-[1.232846739442066547e-02, 9.755102040816326925e-01, 1.576060198296065362e+00], 
-[1.232846739442066547e-02, 9.775510204081632182e-01, 1.716196082773055576e+00], 
-[1.232846739442066547e-02, 9.795918367346938549e-01, 1.883664493667638107e+00], 
-[1.232846739442066547e-02, 9.816326530612244916e-01, 2.087416481520131484e+00], 
-[1.232846739442066547e-02, 9.836734693877551283e-01, 2.340816187139761251e+00], 
-[1.232846739442066547e-02, 9.857142857142857650e-01, 2.664755347919043782e+00], 
-[1.232846739442066547e-02, 9.877551020408162907e-01, 3.093848614580023693e+00], 
-[1.232846739442066547e-02, 9.897959183673469274e-01, 3.689978634952074010e+00], 
-[1.232846739442066547e-02, 9.918367346938775642e-01, 4.575911090285304184e+00], 
-[1.232846739442066547e-02, 9.938775510204082009e-01, 6.035234882466492756e+00], 
-[1.232846739442066547e-02, 9.959183673469387266e-01, 8.907393345729785139e+00], 
-[1.232846739442066547e-02, 9.979591836734693633e-01, 1.730178130447459495e+01], 
-[1.232846739442066547e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.353047774579807516e-02, 1.000000000000000021e-03, 2.478556847206258087e-02], 
-[1.353047774579807516e-02, 1.148922311909569708e-03, 2.476961695999235769e-02], 
-[1.353047774579807516e-02, 1.320022478803632065e-03, 2.475418734752060645e-02], 
-[1.353047774579807516e-02, 1.516603278119670137e-03, 2.473935773797374810e-02], 
-[1.353047774579807516e-02, 1.742459344546885402e-03, 2.472521806452937163e-02], 
-[1.353047774579807516e-02, 2.001950418545241171e-03, 2.471187192689489748e-02], 
-[1.353047774579807516e-02, 2.300085503203331758e-03, 2.469943872742117949e-02], 
-[1.353047774579807516e-02, 2.642619553930058204e-03, 2.468805615954115795e-02], 
-[1.353047774579807516e-02, 3.036164567398761706e-03, 2.467788311267182441e-02], 
-[1.353047774579807516e-02, 3.488317214113704091e-03, 2.466910307064285740e-02], 
-[1.353047774579807516e-02, 4.007805478313466660e-03, 2.466192809739830433e-02], 
-[1.353047774579807516e-02, 4.604657135827751671e-03, 2.465660352427626392e-02], 
-[1.353047774579807516e-02, 5.290393322046124149e-03, 2.465341347943515379e-02], 
-[1.353047774579807516e-02, 6.078250926476181683e-03, 2.465268743243873018e-02], 
-[1.353047774579807516e-02, 6.983438106813499684e-03, 2.465480796950882819e-02], 
-[1.353047774579807516e-02, 8.023427854757562983e-03, 2.466022006832652852e-02], 
-[1.353047774579807516e-02, 9.218295280327699903e-03, 2.466944221077315910e-02], 
-[1.353047774579807516e-02, 1.059110512533918171e-02, 2.468307976199718770e-02], 
-[1.353047774579807516e-02, 1.216835698628199354e-02, 2.470184116182443101e-02], 
-[1.353047774579807516e-02, 1.398049684082008047e-02, 2.472655762925566464e-02], 
-[1.353047774579807516e-02, 1.606250475199945058e-02, 2.475820728569873286e-02], 
-[1.353047774579807516e-02, 1.845457009472566828e-02, 2.479794487597879529e-02], 
-[1.353047774579807516e-02, 2.120286733852943389e-02, 2.484713863341975887e-02], 
-[1.353047774579807516e-02, 2.436044736169515681e-02, 2.490741633300391777e-02], 
-[1.353047774579807516e-02, 2.798826150195019707e-02, 2.498072325627311019e-02], 
-[1.353047774579807516e-02, 3.215633811115024138e-02, 2.506939572860545154e-02], 
-[1.353047774579807516e-02, 3.694513432520856594e-02, 2.517625519360993172e-02], 
-[1.353047774579807516e-02, 4.244708914272822542e-02, 2.530472962385937885e-02], 
-[1.353047774579807516e-02, 4.876840779169493850e-02, 2.545901167767566226e-02], 
-[1.353047774579807516e-02, 5.603111182818285713e-02, 2.564426677376865568e-02], 
-[1.353047774579807516e-02, 6.437539454049952259e-02, 2.586690975324144881e-02], 
-[1.353047774579807516e-02, 7.396232712556144451e-02, 2.613497695700230106e-02], 
-[1.353047774579807516e-02, 8.497696787531199003e-02, 2.645863286157761063e-02], 
-[1.353047774579807516e-02, 9.763193439036874088e-02, 2.685086936030770671e-02], 
-[1.353047774579807516e-02, 1.121715077759858903e-01, 2.732848553892334303e-02], 
-[1.353047774579807516e-02, 1.288763480443681220e-01, 2.791348366862147004e-02], 
-[1.353047774579807516e-02, 1.480689117455977755e-01, 2.863509621758832807e-02], 
-[1.353047774579807516e-02, 1.701196764046864207e-01, 2.953279327460823708e-02], 
-[1.353047774579807516e-02, 1.954542919161802172e-01, 3.066085680047558187e-02], 
-[1.353047774579807516e-02, 2.245617969409859638e-01, 3.209554215417274869e-02], 
-[1.353047774579807516e-02, 2.580040589080049296e-01, 3.394667888403901657e-02], 
-[1.353047774579807516e-02, 2.964266198426381838e-01, 3.637724247128859556e-02], 
-[1.353047774579807516e-02, 3.405711573811430193e-01, 3.963804172037716650e-02], 
-[1.353047774579807516e-02, 3.912898015080607528e-01, 4.413305143326296670e-02], 
-[1.353047774579807516e-02, 4.495615833752782953e-01, 5.055229672319899725e-02], 
-[1.353047774579807516e-02, 5.165113337172515529e-01, 6.017063021851163512e-02], 
-[1.353047774579807516e-02, 5.934313956619206021e-01, 7.561780748120007500e-02], 
-[1.353047774579807516e-02, 6.818065710636164178e-01, 1.033001736822479200e-01], 
-[1.353047774579807516e-02, 7.833427819015473803e-01, 1.639437334696073334e-01], 
-[1.353047774579807516e-02, 9.000000000000000222e-01, 3.844004121827451215e-01], 
-[1.353047774579807516e-02, 9.020408163265306589e-01, 3.928398644235950865e-01], 
-[1.353047774579807516e-02, 9.040816326530612956e-01, 4.016315028448973479e-01], 
-[1.353047774579807516e-02, 9.061224489795918213e-01, 4.107979243705926486e-01], 
-[1.353047774579807516e-02, 9.081632653061224580e-01, 4.203637101385008235e-01], 
-[1.353047774579807516e-02, 9.102040816326530948e-01, 4.303556487728587010e-01], 
-[1.353047774579807516e-02, 9.122448979591837315e-01, 4.408029905548290217e-01], 
-[1.353047774579807516e-02, 9.142857142857142572e-01, 4.517377376039725112e-01], 
-[1.353047774579807516e-02, 9.163265306122448939e-01, 4.631949761749816763e-01], 
-[1.353047774579807516e-02, 9.183673469387755306e-01, 4.752132583872198390e-01], 
-[1.353047774579807516e-02, 9.204081632653061673e-01, 4.878350421960508387e-01], 
-[1.353047774579807516e-02, 9.224489795918368040e-01, 5.011072002577515727e-01], 
-[1.353047774579807516e-02, 9.244897959183673297e-01, 5.150816106282627427e-01], 
-[1.353047774579807516e-02, 9.265306122448979664e-01, 5.298158450933018182e-01], 
-[1.353047774579807516e-02, 9.285714285714286031e-01, 5.453739745151312546e-01], 
-[1.353047774579807516e-02, 9.306122448979592399e-01, 5.618275151134231038e-01], 
-[1.353047774579807516e-02, 9.326530612244897656e-01, 5.792565453584731516e-01], 
-[1.353047774579807516e-02, 9.346938775510204023e-01, 5.977510305268399771e-01], 
-[1.353047774579807516e-02, 9.367346938775510390e-01, 6.174124014690530737e-01], 
-[1.353047774579807516e-02, 9.387755102040816757e-01, 6.383554464717866583e-01], 
-[1.353047774579807516e-02, 9.408163265306123124e-01, 6.607105912346203924e-01], 
-[1.353047774579807516e-02, 9.428571428571428381e-01, 6.846266632759059334e-01], 
-[1.353047774579807516e-02, 9.448979591836734748e-01, 7.102742654327716121e-01], 
-[1.353047774579807516e-02, 9.469387755102041115e-01, 7.378499212262086271e-01], 
-[1.353047774579807516e-02, 9.489795918367347483e-01, 7.675812066042483339e-01], 
-[1.353047774579807516e-02, 9.510204081632652739e-01, 7.997331536051848211e-01], 
-[1.353047774579807516e-02, 9.530612244897959107e-01, 8.346163101378663018e-01], 
-[1.353047774579807516e-02, 9.551020408163265474e-01, 8.725969788445075981e-01], 
-[1.353047774579807516e-02, 9.571428571428571841e-01, 9.141103558883936220e-01], 
-[1.353047774579807516e-02, 9.591836734693878208e-01, 9.596775768808840645e-01], 
-[1.353047774579807516e-02, 9.612244897959183465e-01, 1.009928098340763913e+00], 
-[1.353047774579807516e-02, 9.632653061224489832e-01, 1.065629473524974058e+00], 
-[1.353047774579807516e-02, 9.653061224489796199e-01, 1.127727543565574253e+00], 
-[1.353047774579807516e-02, 9.673469387755102566e-01, 1.197401564653912009e+00], 
-[1.353047774579807516e-02, 9.693877551020407823e-01, 1.276141185862141869e+00], 
-[1.353047774579807516e-02, 9.714285714285714191e-01, 1.365856114819248734e+00], 
-[1.353047774579807516e-02, 9.734693877551020558e-01, 1.469035928601826635e+00], 
-[1.353047774579807516e-02, 9.755102040816326925e-01, 1.588989038675288290e+00], 
-[1.353047774579807516e-02, 9.775510204081632182e-01, 1.730210755800533962e+00], 
-[1.353047774579807516e-02, 9.795918367346938549e-01, 1.898970047366971281e+00], 
-[1.353047774579807516e-02, 9.816326530612244916e-01, 2.104283583119242351e+00], 
-[1.353047774579807516e-02, 9.836734693877551283e-01, 2.359612876914034096e+00], 
-[1.353047774579807516e-02, 9.857142857142857650e-01, 2.686000842104262709e+00], 
-[1.353047774579807516e-02, 9.877551020408162907e-01, 3.118310645397215808e+00], 
-[1.353047774579807516e-02, 9.897959183673469274e-01, 3.718865168342265104e+00], 
-[1.353047774579807516e-02, 9.918367346938775642e-01, 4.611293895010481592e+00], 
-[1.353047774579807516e-02, 9.938775510204082009e-01, 6.081153772591170181e+00], 
-[1.353047774579807516e-02, 9.959183673469387266e-01, 8.973605840087522267e+00], 
-[1.353047774579807516e-02, 9.979591836734693633e-01, 1.742520296741571073e+01], 
-[1.353047774579807516e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.484968262254465071e-02, 1.000000000000000021e-03, 2.503781757611068387e-02], 
-[1.484968262254465071e-02, 1.148922311909569708e-03, 2.502151831556817183e-02], 
-[1.484968262254465071e-02, 1.320022478803632065e-03, 2.500574595550549006e-02], 
-[1.484968262254465071e-02, 1.516603278119670137e-03, 2.499057934361211680e-02], 
-[1.484968262254465071e-02, 1.742459344546885402e-03, 2.497610926958488548e-02], 
-[1.484968262254465071e-02, 2.001950418545241171e-03, 2.496244031914055667e-02], 
-[1.484968262254465071e-02, 2.300085503203331758e-03, 2.494969303026665572e-02], 
-[1.484968262254465071e-02, 2.642619553930058204e-03, 2.493800640512046016e-02], 
-[1.484968262254465071e-02, 3.036164567398761706e-03, 2.492754084229363565e-02], 
-[1.484968262254465071e-02, 3.488317214113704091e-03, 2.491848156723871360e-02], 
-[1.484968262254465071e-02, 4.007805478313466660e-03, 2.491104265547804120e-02], 
-[1.484968262254465071e-02, 4.604657135827751671e-03, 2.490547176397641532e-02], 
-[1.484968262254465071e-02, 5.290393322046124149e-03, 2.490205571254369699e-02], 
-[1.484968262254465071e-02, 6.078250926476181683e-03, 2.490112708992437904e-02], 
-[1.484968262254465071e-02, 6.983438106813499684e-03, 2.490307210207372279e-02], 
-[1.484968262254465071e-02, 8.023427854757562983e-03, 2.490833993402465432e-02], 
-[1.484968262254465071e-02, 9.218295280327699903e-03, 2.491745396689303352e-02], 
-[1.484968262254465071e-02, 1.059110512533918171e-02, 2.493102528240320054e-02], 
-[1.484968262254465071e-02, 1.216835698628199354e-02, 2.494976900604008521e-02], 
-[1.484968262254465071e-02, 1.398049684082008047e-02, 2.497452419609570359e-02], 
-[1.484968262254465071e-02, 1.606250475199945058e-02, 2.500627819268141927e-02], 
-[1.484968262254465071e-02, 1.845457009472566828e-02, 2.504619661669822694e-02], 
-[1.484968262254465071e-02, 2.120286733852943389e-02, 2.509566057940851302e-02], 
-[1.484968262254465071e-02, 2.436044736169515681e-02, 2.515631316554692992e-02], 
-[1.484968262254465071e-02, 2.798826150195019707e-02, 2.523011793882836556e-02], 
-[1.484968262254465071e-02, 3.215633811115024138e-02, 2.531943316428976118e-02], 
-[1.484968262254465071e-02, 3.694513432520856594e-02, 2.542710675797226622e-02], 
-[1.484968262254465071e-02, 4.244708914272822542e-02, 2.555659882571938157e-02], 
-[1.484968262254465071e-02, 4.876840779169493850e-02, 2.571214128720379286e-02], 
-[1.484968262254465071e-02, 5.603111182818285713e-02, 2.589894787766703482e-02], 
-[1.484968262254465071e-02, 6.437539454049952259e-02, 2.612349336755123708e-02], 
-[1.484968262254465071e-02, 7.396232712556144451e-02, 2.639388907272244636e-02], 
-[1.484968262254465071e-02, 8.497696787531199003e-02, 2.672039415434489945e-02], 
-[1.484968262254465071e-02, 9.763193439036874088e-02, 2.711612132235779321e-02], 
-[1.484968262254465071e-02, 1.121715077759858903e-01, 2.759802558627883970e-02], 
-[1.484968262254465071e-02, 1.288763480443681220e-01, 2.818831300060277434e-02], 
-[1.484968262254465071e-02, 1.480689117455977755e-01, 2.891648613700128004e-02], 
-[1.484968262254465071e-02, 1.701196764046864207e-01, 2.982237880779509825e-02], 
-[1.484968262254465071e-02, 1.954542919161802172e-01, 3.096077169238446031e-02], 
-[1.484968262254465071e-02, 2.245617969409859638e-01, 3.240861839018129020e-02], 
-[1.484968262254465071e-02, 2.580040589080049296e-01, 3.427675029570302623e-02], 
-[1.484968262254465071e-02, 2.964266198426381838e-01, 3.672962312921147776e-02], 
-[1.484968262254465071e-02, 3.405711573811430193e-01, 4.002031252185322269e-02], 
-[1.484968262254465071e-02, 3.912898015080607528e-01, 4.455642385803905425e-02], 
-[1.484968262254465071e-02, 4.495615833752782953e-01, 5.103414297330071542e-02], 
-[1.484968262254465071e-02, 5.165113337172515529e-01, 6.073961642147279738e-02], 
-[1.484968262254465071e-02, 5.934313956619206021e-01, 7.632567713734561554e-02], 
-[1.484968262254465071e-02, 6.818065710636164178e-01, 1.042542159655967804e-01], 
-[1.484968262254465071e-02, 7.833427819015473803e-01, 1.654279690424869664e-01], 
-[1.484968262254465071e-02, 9.000000000000000222e-01, 3.877496256420748799e-01], 
-[1.484968262254465071e-02, 9.020408163265306589e-01, 3.962591303428637524e-01], 
-[1.484968262254465071e-02, 9.040816326530612956e-01, 4.051236616683115410e-01], 
-[1.484968262254465071e-02, 9.061224489795918213e-01, 4.143659952507054989e-01], 
-[1.484968262254465071e-02, 9.081632653061224580e-01, 4.240109063961854385e-01], 
-[1.484968262254465071e-02, 9.102040816326530948e-01, 4.340853950759110402e-01], 
-[1.484968262254465071e-02, 9.122448979591837315e-01, 4.446189420506037049e-01], 
-[1.484968262254465071e-02, 9.142857142857142572e-01, 4.556438012800489989e-01], 
-[1.484968262254465071e-02, 9.163265306122448939e-01, 4.671953347678952095e-01], 
-[1.484968262254465071e-02, 9.183673469387755306e-01, 4.793123972143921718e-01], 
-[1.484968262254465071e-02, 9.204081632653061673e-01, 4.920377793523035281e-01], 
-[1.484968262254465071e-02, 9.224489795918368040e-01, 5.054187206977744928e-01], 
-[1.484968262254465071e-02, 9.244897959183673297e-01, 5.195075047534507551e-01], 
-[1.484968262254465071e-02, 9.265306122448979664e-01, 5.343621525796637961e-01], 
-[1.484968262254465071e-02, 9.285714285714286031e-01, 5.500472342639080026e-01], 
-[1.484968262254465071e-02, 9.306122448979592399e-01, 5.666348223846029430e-01], 
-[1.484968262254465071e-02, 9.326530612244897656e-01, 5.842056173685792331e-01], 
-[1.484968262254465071e-02, 9.346938775510204023e-01, 6.028502820680535779e-01], 
-[1.484968262254465071e-02, 9.367346938775510390e-01, 6.226710324525133178e-01], 
-[1.484968262254465071e-02, 9.387755102040816757e-01, 6.437835437345373890e-01], 
-[1.484968262254465071e-02, 9.408163265306123124e-01, 6.663192475049544150e-01], 
-[1.484968262254465071e-02, 9.428571428571428381e-01, 6.904281169034380827e-01], 
-[1.484968262254465071e-02, 9.448979591836734748e-01, 7.162820654088133399e-01], 
-[1.484968262254465071e-02, 9.469387755102041115e-01, 7.440791232178529668e-01], 
-[1.484968262254465071e-02, 9.489795918367347483e-01, 7.740486073009005263e-01], 
-[1.484968262254465071e-02, 9.510204081632652739e-01, 8.064575727686937867e-01], 
-[1.484968262254465071e-02, 9.530612244897959107e-01, 8.416189325564727985e-01], 
-[1.484968262254465071e-02, 9.551020408163265474e-01, 8.799017722055407775e-01], 
-[1.484968262254465071e-02, 9.571428571428571841e-01, 9.217445858299736505e-01], 
-[1.484968262254465071e-02, 9.591836734693878208e-01, 9.676724477933467128e-01], 
-[1.484968262254465071e-02, 9.612244897959183465e-01, 1.018319558828338689e+00], 
-[1.484968262254465071e-02, 9.632653061224489832e-01, 1.074459240299775242e+00], 
-[1.484968262254465071e-02, 9.653061224489796199e-01, 1.137044419288367303e+00], 
-[1.484968262254465071e-02, 9.673469387755102566e-01, 1.207263157671217613e+00], 
-[1.484968262254465071e-02, 9.693877551020407823e-01, 1.286616189236529095e+00], 
-[1.484968262254465071e-02, 9.714285714285714191e-01, 1.377027379276741126e+00], 
-[1.484968262254465071e-02, 9.734693877551020558e-01, 1.481004687958856536e+00], 
-[1.484968262254465071e-02, 9.755102040816326925e-01, 1.601880851432136765e+00], 
-[1.484968262254465071e-02, 9.775510204081632182e-01, 1.744184078239796598e+00], 
-[1.484968262254465071e-02, 9.795918367346938549e-01, 1.914228981340878377e+00], 
-[1.484968262254465071e-02, 9.816326530612244916e-01, 2.121097517177370495e+00], 
-[1.484968262254465071e-02, 9.836734693877551283e-01, 2.378348067575980718e+00], 
-[1.484968262254465071e-02, 9.857142857142857650e-01, 2.707173917299038557e+00], 
-[1.484968262254465071e-02, 9.877551020408162907e-01, 3.142685388090744603e+00], 
-[1.484968262254465071e-02, 9.897959183673469274e-01, 3.747643104973152450e+00], 
-[1.484968262254465071e-02, 9.918367346938775642e-01, 4.646535281132457840e+00], 
-[1.484968262254465071e-02, 9.938775510204082009e-01, 6.126874811777959451e+00], 
-[1.484968262254465071e-02, 9.959183673469387266e-01, 9.039503169674468097e+00], 
-[1.484968262254465071e-02, 9.979591836734693633e-01, 1.754793782082121467e+01], 
-[1.484968262254465071e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.629750834620644420e-02, 1.000000000000000021e-03, 2.529041725154282383e-02], 
-[1.629750834620644420e-02, 1.148922311909569708e-03, 2.527376631409612717e-02], 
-[1.629750834620644420e-02, 1.320022478803632065e-03, 2.525764727909291310e-02], 
-[1.629750834620644420e-02, 1.516603278119670137e-03, 2.524213973867430599e-02], 
-[1.629750834620644420e-02, 1.742459344546885402e-03, 2.522733533914769261e-02], 
-[1.629750834620644420e-02, 2.001950418545241171e-03, 2.521333965233189117e-02], 
-[1.629750834620644420e-02, 2.300085503203331758e-03, 2.520027435194425319e-02], 
-[1.629750834620644420e-02, 2.642619553930058204e-03, 2.518827974895758784e-02], 
-[1.629750834620644420e-02, 3.036164567398761706e-03, 2.517751775122506475e-02], 
-[1.629750834620644420e-02, 3.488317214113704091e-03, 2.516817532590129303e-02], 
-[1.629750834620644420e-02, 4.007805478313466660e-03, 2.516046856015439689e-02], 
-[1.629750834620644420e-02, 4.604657135827751671e-03, 2.515464743662596328e-02], 
-[1.629750834620644420e-02, 5.290393322046124149e-03, 2.515100146680386561e-02], 
-[1.629750834620644420e-02, 6.078250926476181683e-03, 2.514986635860731734e-02], 
-[1.629750834620644420e-02, 6.983438106813499684e-03, 2.515163193767583696e-02], 
-[1.629750834620644420e-02, 8.023427854757562983e-03, 2.515675159628819046e-02], 
-[1.629750834620644420e-02, 9.218295280327699903e-03, 2.516575361461450069e-02], 
-[1.629750834620644420e-02, 1.059110512533918171e-02, 2.517925479067845834e-02], 
-[1.629750834620644420e-02, 1.216835698628199354e-02, 2.519797693522266707e-02], 
-[1.629750834620644420e-02, 1.398049684082008047e-02, 2.522276694526753849e-02], 
-[1.629750834620644420e-02, 1.606250475199945058e-02, 2.525462137885585434e-02], 
-[1.629750834620644420e-02, 1.845457009472566828e-02, 2.529471673192062661e-02], 
-[1.629750834620644420e-02, 2.120286733852943389e-02, 2.534444699226433631e-02], 
-[1.629750834620644420e-02, 2.436044736169515681e-02, 2.540547055251048472e-02], 
-[1.629750834620644420e-02, 2.798826150195019707e-02, 2.547976925606924847e-02], 
-[1.629750834620644420e-02, 3.215633811115024138e-02, 2.556972330434116938e-02], 
-[1.629750834620644420e-02, 3.694513432520856594e-02, 2.567820708140693131e-02], 
-[1.629750834620644420e-02, 4.244708914272822542e-02, 2.580871282050144905e-02], 
-[1.629750834620644420e-02, 4.876840779169493850e-02, 2.596551169473436393e-02], 
-[1.629750834620644420e-02, 5.603111182818285713e-02, 2.615386574515134177e-02], 
-[1.629750834620644420e-02, 6.437539454049952259e-02, 2.638030965687264418e-02], 
-[1.629750834620644420e-02, 7.396232712556144451e-02, 2.665302970048975123e-02], 
-[1.629750834620644420e-02, 8.497696787531199003e-02, 2.698237969360671798e-02], 
-[1.629750834620644420e-02, 9.763193439036874088e-02, 2.738159312298905218e-02], 
-[1.629750834620644420e-02, 1.121715077759858903e-01, 2.786778086514337532e-02], 
-[1.629750834620644420e-02, 1.288763480443681220e-01, 2.846335267561964436e-02], 
-[1.629750834620644420e-02, 1.480689117455977755e-01, 2.919808110865785775e-02], 
-[1.629750834620644420e-02, 1.701196764046864207e-01, 3.011216351928185445e-02], 
-[1.629750834620644420e-02, 1.954542919161802172e-01, 3.126087902979127892e-02], 
-[1.629750834620644420e-02, 2.245617969409859638e-01, 3.272187905023483945e-02], 
-[1.629750834620644420e-02, 2.580040589080049296e-01, 3.460699613363739380e-02], 
-[1.629750834620644420e-02, 2.964266198426381838e-01, 3.708216510419840017e-02], 
-[1.629750834620644420e-02, 3.405711573811430193e-01, 4.040272647321083155e-02], 
-[1.629750834620644420e-02, 3.912898015080607528e-01, 4.497991270573602207e-02], 
-[1.629750834620644420e-02, 4.495615833752782953e-01, 5.151606365734369419e-02], 
-[1.629750834620644420e-02, 5.165113337172515529e-01, 6.130860586777361204e-02], 
-[1.629750834620644420e-02, 5.934313956619206021e-01, 7.703341704648652977e-02], 
-[1.629750834620644420e-02, 6.818065710636164178e-01, 1.052078426420868795e-01], 
-[1.629750834620644420e-02, 7.833427819015473803e-01, 1.669110049343407731e-01], 
-[1.629750834620644420e-02, 9.000000000000000222e-01, 3.910937289787096427e-01], 
-[1.629750834620644420e-02, 9.020408163265306589e-01, 3.996731140869057564e-01], 
-[1.629750834620644420e-02, 9.040816326530612956e-01, 4.086103577215552951e-01], 
-[1.629750834620644420e-02, 9.061224489795918213e-01, 4.179284136186713905e-01], 
-[1.629750834620644420e-02, 9.081632653061224580e-01, 4.276522505913673555e-01], 
-[1.629750834620644420e-02, 9.102040816326530948e-01, 4.378090792329498160e-01], 
-[1.629750834620644420e-02, 9.122448979591837315e-01, 4.484286099878186382e-01], 
-[1.629750834620644420e-02, 9.142857142857142572e-01, 4.595433477802001732e-01], 
-[1.629750834620644420e-02, 9.163265306122448939e-01, 4.711889293968800074e-01], 
-[1.629750834620644420e-02, 9.183673469387755306e-01, 4.834045110514459953e-01], 
-[1.629750834620644420e-02, 9.204081632653061673e-01, 4.962332150712316925e-01], 
-[1.629750834620644420e-02, 9.224489795918368040e-01, 5.097226465183850586e-01], 
-[1.629750834620644420e-02, 9.244897959183673297e-01, 5.239254928789686128e-01], 
-[1.629750834620644420e-02, 9.265306122448979664e-01, 5.389002228536723393e-01], 
-[1.629750834620644420e-02, 9.285714285714286031e-01, 5.547119039246550809e-01], 
-[1.629750834620644420e-02, 9.306122448979592399e-01, 5.714331629722515515e-01], 
-[1.629750834620644420e-02, 9.326530612244897656e-01, 5.891453200611730390e-01], 
-[1.629750834620644420e-02, 9.346938775510204023e-01, 6.079397329964013608e-01], 
-[1.629750834620644420e-02, 9.367346938775510390e-01, 6.279193998883845218e-01], 
-[1.629750834620644420e-02, 9.387755102040816757e-01, 6.492008794811733319e-01], 
-[1.629750834620644420e-02, 9.408163265306123124e-01, 6.719166053715998066e-01], 
-[1.629750834620644420e-02, 9.428571428571428381e-01, 6.962176918538306447e-01], 
-[1.629750834620644420e-02, 9.448979591836734748e-01, 7.222773578884740253e-01], 
-[1.629750834620644420e-02, 9.469387755102041115e-01, 7.502951343571343523e-01], 
-[1.629750834620644420e-02, 9.489795918367347483e-01, 7.805020722585105375e-01], 
-[1.629750834620644420e-02, 9.510204081632652739e-01, 8.131672415626853834e-01], 
-[1.629750834620644420e-02, 9.530612244897959107e-01, 8.486059105249948997e-01], 
-[1.629750834620644420e-02, 9.551020408163265474e-01, 8.871899360355453013e-01], 
-[1.629750834620644420e-02, 9.571428571428571841e-01, 9.293610963112269863e-01], 
-[1.629750834620644420e-02, 9.591836734693878208e-01, 9.756483877287652762e-01], 
-[1.629750834620644420e-02, 9.612244897959183465e-01, 1.026690734818849204e+00], 
-[1.629750834620644420e-02, 9.632653061224489832e-01, 1.083267201907136545e+00], 
-[1.629750834620644420e-02, 9.653061224489796199e-01, 1.146337770708586223e+00], 
-[1.629750834620644420e-02, 9.673469387755102566e-01, 1.217099269315903065e+00], 
-[1.629750834620644420e-02, 9.693877551020407823e-01, 1.297063465803496740e+00], 
-[1.629750834620644420e-02, 9.714285714285714191e-01, 1.388168317701941934e+00], 
-[1.629750834620644420e-02, 9.734693877551020558e-01, 1.492940081902998539e+00], 
-[1.629750834620644420e-02, 9.755102040816326925e-01, 1.614735702943000728e+00], 
-[1.629750834620644420e-02, 9.775510204081632182e-01, 1.758116126904291754e+00], 
-[1.629750834620644420e-02, 9.795918367346938549e-01, 1.929441385496157402e+00], 
-[1.629750834620644420e-02, 9.816326530612244916e-01, 2.137858390379478113e+00], 
-[1.629750834620644420e-02, 9.836734693877551283e-01, 2.397021887875413704e+00], 
-[1.629750834620644420e-02, 9.857142857142857650e-01, 2.728274732227234711e+00], 
-[1.629750834620644420e-02, 9.877551020408162907e-01, 3.166973043839272250e+00], 
-[1.629750834620644420e-02, 9.897959183673469274e-01, 3.776312709610331275e+00], 
-[1.629750834620644420e-02, 9.918367346938775642e-01, 4.681635616455807281e+00], 
-[1.629750834620644420e-02, 9.938775510204082009e-01, 6.172398556052629104e+00], 
-[1.629750834620644420e-02, 9.959183673469387266e-01, 9.105086313245323026e+00], 
-[1.629750834620644420e-02, 9.979591836734693633e-01, 1.766998834516919459e+01], 
-[1.629750834620644420e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.788649529057435156e-02, 1.000000000000000021e-03, 2.554336774246567660e-02], 
-[1.788649529057435156e-02, 1.148922311909569708e-03, 2.552636119287939390e-02], 
-[1.788649529057435156e-02, 1.320022478803632065e-03, 2.550989154877403298e-02], 
-[1.788649529057435156e-02, 1.516603278119670137e-03, 2.549403914682968342e-02], 
-[1.788649529057435156e-02, 1.742459344546885402e-03, 2.547889649005424112e-02], 
-[1.788649529057435156e-02, 2.001950418545241171e-03, 2.546457013645968617e-02], 
-[1.788649529057435156e-02, 2.300085503203331758e-03, 2.545118289558451902e-02], 
-[1.788649529057435156e-02, 2.642619553930058204e-03, 2.543887638730616199e-02], 
-[1.788649529057435156e-02, 3.036164567398761706e-03, 2.542781402882374892e-02], 
-[1.788649529057435156e-02, 3.488317214113704091e-03, 2.541818452907037770e-02], 
-[1.788649529057435156e-02, 4.007805478313466660e-03, 2.541020598692429744e-02], 
-[1.788649529057435156e-02, 4.604657135827751671e-03, 2.540413071075030976e-02], 
-[1.788649529057435156e-02, 5.290393322046124149e-03, 2.540025090373664030e-02], 
-[1.788649529057435156e-02, 6.078250926476181683e-03, 2.539890539296638799e-02], 
-[1.788649529057435156e-02, 6.983438106813499684e-03, 2.540048762370857027e-02], 
-[1.788649529057435156e-02, 8.023427854757562983e-03, 2.540545519537529620e-02], 
-[1.788649529057435156e-02, 9.218295280327699903e-03, 2.541434128700329614e-02], 
-[1.788649529057435156e-02, 1.059110512533918171e-02, 2.542776841263023196e-02], 
-[1.788649529057435156e-02, 1.216835698628199354e-02, 2.544646506784917911e-02], 
-[1.788649529057435156e-02, 1.398049684082008047e-02, 2.547128598782175124e-02], 
-[1.788649529057435156e-02, 1.606250475199945058e-02, 2.550323694774884672e-02], 
-[1.788649529057435156e-02, 1.845457009472566828e-02, 2.554350531753137379e-02], 
-[1.788649529057435156e-02, 2.120286733852943389e-02, 2.559349796009461817e-02], 
-[1.788649529057435156e-02, 2.436044736169515681e-02, 2.565488857406506701e-02], 
-[1.788649529057435156e-02, 2.798826150195019707e-02, 2.572967728004397700e-02], 
-[1.788649529057435156e-02, 3.215633811115024138e-02, 2.582026621246877318e-02], 
-[1.788649529057435156e-02, 3.694513432520856594e-02, 2.592955621902957863e-02], 
-[1.788649529057435156e-02, 4.244708914272822542e-02, 2.606107165442826668e-02], 
-[1.788649529057435156e-02, 4.876840779169493850e-02, 2.621912293724321455e-02], 
-[1.788649529057435156e-02, 5.603111182818285713e-02, 2.640902040353061697e-02], 
-[1.788649529057435156e-02, 6.437539454049952259e-02, 2.663735863834470682e-02], 
-[1.788649529057435156e-02, 7.396232712556144451e-02, 2.691239884667960200e-02], 
-[1.788649529057435156e-02, 8.497696787531199003e-02, 2.724458947424780036e-02], 
-[1.788649529057435156e-02, 9.763193439036874088e-02, 2.764728474472109149e-02], 
-[1.788649529057435156e-02, 1.121715077759858903e-01, 2.813775134460374042e-02], 
-[1.788649529057435156e-02, 1.288763480443681220e-01, 2.873860264801464046e-02], 
-[1.788649529057435156e-02, 1.480689117455977755e-01, 2.947988107053358536e-02], 
-[1.788649529057435156e-02, 1.701196764046864207e-01, 3.040214732865245684e-02], 
-[1.788649529057435156e-02, 1.954542919161802172e-01, 3.156117871134081487e-02], 
-[1.788649529057435156e-02, 2.245617969409859638e-01, 3.303532400880444808e-02], 
-[1.788649529057435156e-02, 2.580040589080049296e-01, 3.493741624399591961e-02], 
-[1.788649529057435156e-02, 2.964266198426381838e-01, 3.743486820873420662e-02], 
-[1.788649529057435156e-02, 3.405711573811430193e-01, 4.078528334631560670e-02], 
-[1.788649529057435156e-02, 3.912898015080607528e-01, 4.540351769858963493e-02], 
-[1.788649529057435156e-02, 4.495615833752782953e-01, 5.199805843650769782e-02], 
-[1.788649529057435156e-02, 5.165113337172515529e-01, 6.187759814428941962e-02], 
-[1.788649529057435156e-02, 5.934313956619206021e-01, 7.774102671153398925e-02], 
-[1.788649529057435156e-02, 6.818065710636164178e-01, 1.061610531554161713e-01], 
-[1.788649529057435156e-02, 7.833427819015473803e-01, 1.683928407983668052e-01], 
-[1.788649529057435156e-02, 9.000000000000000222e-01, 3.944327255224197026e-01], 
-[1.788649529057435156e-02, 9.020408163265306589e-01, 4.030818191997778688e-01], 
-[1.788649529057435156e-02, 9.040816326530612956e-01, 4.120915947769141496e-01], 
-[1.788649529057435156e-02, 9.061224489795918213e-01, 4.214851834900954497e-01], 
-[1.788649529057435156e-02, 9.081632653061224580e-01, 4.312877469993299240e-01], 
-[1.788649529057435156e-02, 9.102040816326530948e-01, 4.415267057966965614e-01], 
-[1.788649529057435156e-02, 9.122448979591837315e-01, 4.522319992159478663e-01], 
-[1.788649529057435156e-02, 9.142857142857142572e-01, 4.634363822716929260e-01], 
-[1.788649529057435156e-02, 9.163265306122448939e-01, 4.751757655699584415e-01], 
-[1.788649529057435156e-02, 9.183673469387755306e-01, 4.874896057722655773e-01], 
-[1.788649529057435156e-02, 9.204081632653061673e-01, 5.004213556200887147e-01], 
-[1.788649529057435156e-02, 9.224489795918368040e-01, 5.140189844104056105e-01], 
-[1.788649529057435156e-02, 9.244897959183673297e-01, 5.283355821524352569e-01], 
-[1.788649529057435156e-02, 9.265306122448979664e-01, 5.434300635563888981e-01], 
-[1.788649529057435156e-02, 9.285714285714286031e-01, 5.593679916723903744e-01], 
-[1.788649529057435156e-02, 9.306122448979592399e-01, 5.762225456302478843e-01], 
-[1.788649529057435156e-02, 9.326530612244897656e-01, 5.940756628189046706e-01], 
-[1.788649529057435156e-02, 9.346938775510204023e-01, 6.130193933789361838e-01], 
-[1.788649529057435156e-02, 9.367346938775510390e-01, 6.331575145903227675e-01], 
-[1.788649529057435156e-02, 9.387755102040816757e-01, 6.546074653417277567e-01], 
-[1.788649529057435156e-02, 9.408163265306123124e-01, 6.775026773595078655e-01], 
-[1.788649529057435156e-02, 9.428571428571428381e-01, 7.019954016356938498e-01], 
-[1.788649529057435156e-02, 9.448979591836734748e-01, 7.282601574646841991e-01], 
-[1.788649529057435156e-02, 9.469387755102041115e-01, 7.564979704359784396e-01], 
-[1.788649529057435156e-02, 9.489795918367347483e-01, 7.869416185992397228e-01], 
-[1.788649529057435156e-02, 9.510204081632652739e-01, 8.198621785904942616e-01], 
-[1.788649529057435156e-02, 9.530612244897959107e-01, 8.555772643024728286e-01], 
-[1.788649529057435156e-02, 9.551020408163265474e-01, 8.944614924522491517e-01], 
-[1.788649529057435156e-02, 9.571428571428571841e-01, 9.369599115461371142e-01], 
-[1.788649529057435156e-02, 9.591836734693878208e-01, 9.836054232773490114e-01], 
-[1.788649529057435156e-02, 9.612244897959183465e-01, 1.035041655611200095e+00], 
-[1.788649529057435156e-02, 9.632653061224489832e-01, 1.092053390752752318e+00], 
-[1.788649529057435156e-02, 9.653061224489796199e-01, 1.155607633819840885e+00], 
-[1.788649529057435156e-02, 9.673469387755102566e-01, 1.226909939756991363e+00], 
-[1.788649529057435156e-02, 9.693877551020407823e-01, 1.307483060633211513e+00], 
-[1.788649529057435156e-02, 9.714285714285714191e-01, 1.399278980974435926e+00], 
-[1.788649529057435156e-02, 9.734693877551020558e-01, 1.504842168277002568e+00], 
-[1.788649529057435156e-02, 9.755102040816326925e-01, 1.627553659504595407e+00], 
-[1.788649529057435156e-02, 9.775510204081632182e-01, 1.772006978509578889e+00], 
-[1.788649529057435156e-02, 9.795918367346938549e-01, 1.944607349618006742e+00], 
-[1.788649529057435156e-02, 9.816326530612244916e-01, 2.154566309257048839e+00], 
-[1.788649529057435156e-02, 9.836734693877551283e-01, 2.415634466364964261e+00], 
-[1.788649529057435156e-02, 9.857142857142857650e-01, 2.749303445353312725e+00], 
-[1.788649529057435156e-02, 9.877551020408162907e-01, 3.191173813469376785e+00], 
-[1.788649529057435156e-02, 9.897959183673469274e-01, 3.804874246520605574e+00], 
-[1.788649529057435156e-02, 9.918367346938775642e-01, 4.716595268033452193e+00], 
-[1.788649529057435156e-02, 9.938775510204082009e-01, 6.217725560192757683e+00], 
-[1.788649529057435156e-02, 9.959183673469387266e-01, 9.170356247087021018e+00], 
-[1.788649529057435156e-02, 9.979591836734693633e-01, 1.779135701354163857e+01], 
-[1.788649529057435156e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.963040650040271534e-02, 1.000000000000000021e-03, 2.579666929305698270e-02], 
-[1.963040650040271534e-02, 1.148922311909569708e-03, 2.577930318928812331e-02], 
-[1.963040650040271534e-02, 1.320022478803632065e-03, 2.576247899510286654e-02], 
-[1.963040650040271534e-02, 1.516603278119670137e-03, 2.574627779180641354e-02], 
-[1.963040650040271534e-02, 1.742459344546885402e-03, 2.573079293919566801e-02], 
-[1.963040650040271534e-02, 2.001950418545241171e-03, 2.571613198156531832e-02], 
-[1.963040650040271534e-02, 2.300085503203331758e-03, 2.570241886436450823e-02], 
-[1.963040650040271534e-02, 2.642619553930058204e-03, 2.568979651646222800e-02], 
-[1.963040650040271534e-02, 3.036164567398761706e-03, 2.567842986448561765e-02], 
-[1.963040650040271534e-02, 3.488317214113704091e-03, 2.566850935921997923e-02], 
-[1.963040650040271534e-02, 4.007805478313466660e-03, 2.566025511131476977e-02], 
-[1.963040650040271534e-02, 4.604657135827751671e-03, 2.565392175490084636e-02], 
-[1.963040650040271534e-02, 5.290393322046124149e-03, 2.564980418488491815e-02], 
-[1.963040650040271534e-02, 6.078250926476181683e-03, 2.564824434749828075e-02], 
-[1.963040650040271534e-02, 6.983438106813499684e-03, 2.564963930757909599e-02], 
-[1.963040650040271534e-02, 8.023427854757562983e-03, 2.565445087155387993e-02], 
-[1.963040650040271534e-02, 9.218295280327699903e-03, 2.566321711713074466e-02], 
-[1.963040650040271534e-02, 1.059110512533918171e-02, 2.567656627406745065e-02], 
-[1.963040650040271534e-02, 1.216835698628199354e-02, 2.569523352238135827e-02], 
-[1.963040650040271534e-02, 1.398049684082008047e-02, 2.572008143480252959e-02], 
-[1.963040650040271534e-02, 1.606250475199945058e-02, 2.575212500287679673e-02], 
-[1.963040650040271534e-02, 1.845457009472566828e-02, 2.579256246940151223e-02], 
-[1.963040650040271534e-02, 2.120286733852943389e-02, 2.584281357098846058e-02], 
-[1.963040650040271534e-02, 2.436044736169515681e-02, 2.590456731035901961e-02], 
-[1.963040650040271534e-02, 2.798826150195019707e-02, 2.597984208277482124e-02], 
-[1.963040650040271534e-02, 3.215633811115024138e-02, 2.607106195235206481e-02], 
-[1.963040650040271534e-02, 3.694513432520856594e-02, 2.618115422592262598e-02], 
-[1.963040650040271534e-02, 4.244708914272822542e-02, 2.631367537368586862e-02], 
-[1.963040650040271534e-02, 4.876840779169493850e-02, 2.647297505166621226e-02], 
-[1.963040650040271534e-02, 5.603111182818285713e-02, 2.666441188007080687e-02], 
-[1.963040650040271534e-02, 6.437539454049952259e-02, 2.689464032906451960e-02], 
-[1.963040650040271534e-02, 7.396232712556144451e-02, 2.717199651761705720e-02], 
-[1.963040650040271534e-02, 8.497696787531199003e-02, 2.750702349110264316e-02], 
-[1.963040650040271534e-02, 9.763193439036874088e-02, 2.791319617002199424e-02], 
-[1.963040650040271534e-02, 1.121715077759858903e-01, 2.840793699369464909e-02], 
-[1.963040650040271534e-02, 1.288763480443681220e-01, 2.901406287207895091e-02], 
-[1.963040650040271534e-02, 1.480689117455977755e-01, 2.976188596055479724e-02], 
-[1.963040650040271534e-02, 1.701196764046864207e-01, 3.069233015544586829e-02], 
-[1.963040650040271534e-02, 1.954542919161802172e-01, 3.186167063563996593e-02], 
-[1.963040650040271534e-02, 2.245617969409859638e-01, 3.334895314033455016e-02], 
-[1.963040650040271534e-02, 2.580040589080049296e-01, 3.526801047292281444e-02], 
-[1.963040650040271534e-02, 2.964266198426381838e-01, 3.778773225531995017e-02], 
-[1.963040650040271534e-02, 3.405711573811430193e-01, 4.116798291308844393e-02], 
-[1.963040650040271534e-02, 3.912898015080607528e-01, 4.582723855895096121e-02], 
-[1.963040650040271534e-02, 4.495615833752782953e-01, 5.248012697218218392e-02], 
-[1.963040650040271534e-02, 5.165113337172515529e-01, 6.244659283825943624e-02], 
-[1.963040650040271534e-02, 5.934313956619206021e-01, 7.844850563602907834e-02], 
-[1.963040650040271534e-02, 6.818065710636164178e-01, 1.071138469504078206e-01], 
-[1.963040650040271534e-02, 7.833427819015473803e-01, 1.698734762898930772e-01], 
-[1.963040650040271534e-02, 9.000000000000000222e-01, 3.977666186060530018e-01], 
-[1.963040650040271534e-02, 9.020408163265306589e-01, 4.064852492285487839e-01], 
-[1.963040650040271534e-02, 9.040816326530612956e-01, 4.155673766096089627e-01], 
-[1.963040650040271534e-02, 9.061224489795918213e-01, 4.250363088834284708e-01], 
-[1.963040650040271534e-02, 9.081632653061224580e-01, 4.349173998980989109e-01], 
-[1.963040650040271534e-02, 9.102040816326530948e-01, 4.452382793224965440e-01], 
-[1.963040650040271534e-02, 9.122448979591837315e-01, 4.560291145869532770e-01], 
-[1.963040650040271534e-02, 9.142857142857142572e-01, 4.673229099241269502e-01], 
-[1.963040650040271534e-02, 9.163265306122448939e-01, 4.791558487973077152e-01], 
-[1.963040650040271534e-02, 9.183673469387755306e-01, 4.915676872526896224e-01], 
-[1.963040650040271534e-02, 9.204081632653061673e-01, 5.046022072678544301e-01], 
-[1.963040650040271534e-02, 9.224489795918368040e-01, 5.183077410661248718e-01], 
-[1.963040650040271534e-02, 9.244897959183673297e-01, 5.327377797226429124e-01], 
-[1.963040650040271534e-02, 9.265306122448979664e-01, 5.479516823297156947e-01], 
-[1.963040650040271534e-02, 9.285714285714286031e-01, 5.640155056825943980e-01], 
-[1.963040650040271534e-02, 9.306122448979592399e-01, 5.810029791125064236e-01], 
-[1.963040650040271534e-02, 9.326530612244897656e-01, 5.989966550239735898e-01], 
-[1.963040650040271534e-02, 9.346938775510204023e-01, 6.180892732817087065e-01], 
-[1.963040650040271534e-02, 9.367346938775510390e-01, 6.383853873703555504e-01], 
-[1.963040650040271534e-02, 9.387755102040816757e-01, 6.600033129438921398e-01], 
-[1.963040650040271534e-02, 9.408163265306123124e-01, 6.830774759904758575e-01], 
-[1.963040650040271534e-02, 9.428571428571428381e-01, 7.077612597535543060e-01], 
-[1.963040650040271534e-02, 9.448979591836734748e-01, 7.342304787252293963e-01], 
-[1.963040650040271534e-02, 9.469387755102041115e-01, 7.626876472399479745e-01], 
-[1.963040650040271534e-02, 9.489795918367347483e-01, 7.933672634374804300e-01], 
-[1.963040650040271534e-02, 9.510204081632652739e-01, 8.265424024460694685e-01], 
-[1.963040650040271534e-02, 9.530612244897959107e-01, 8.625330141366848169e-01], 
-[1.963040650040271534e-02, 9.551020408163265474e-01, 9.017164635599361766e-01], 
-[1.963040650040271534e-02, 9.571428571428571841e-01, 9.445410557326859857e-01], 
-[1.963040650040271534e-02, 9.591836734693878208e-01, 9.915435810103275793e-01], 
-[1.963040650040271534e-02, 9.612244897959183465e-01, 1.043372350481782007e+00], 
-[1.963040650040271534e-02, 9.632653061224489832e-01, 1.100817839215605609e+00], 
-[1.963040650040271534e-02, 9.653061224489796199e-01, 1.164854044584009429e+00], 
-[1.963040650040271534e-02, 9.673469387755102566e-01, 1.236695209125719952e+00], 
-[1.963040650040271534e-02, 9.693877551020407823e-01, 1.317875018750692462e+00], 
-[1.963040650040271534e-02, 9.714285714285714191e-01, 1.410359419919607671e+00], 
-[1.963040650040271534e-02, 9.734693877551020558e-01, 1.516711004858158685e+00], 
-[1.963040650040271534e-02, 9.755102040816326925e-01, 1.640334787333978639e+00], 
-[1.963040650040271534e-02, 9.775510204081632182e-01, 1.785856709673362852e+00], 
-[1.963040650040271534e-02, 9.795918367346938549e-01, 1.959726963369929020e+00], 
-[1.963040650040271534e-02, 9.816326530612244916e-01, 2.171221380188190331e+00], 
-[1.963040650040271534e-02, 9.836734693877551283e-01, 2.434185931400241643e+00], 
-[1.963040650040271534e-02, 9.857142857142857650e-01, 2.770260214882584116e+00], 
-[1.963040650040271534e-02, 9.877551020408162907e-01, 3.215287897455946009e+00], 
-[1.963040650040271534e-02, 9.897959183673469274e-01, 3.833327979472652913e+00], 
-[1.963040650040271534e-02, 9.918367346938775642e-01, 4.751414602167750800e+00], 
-[1.963040650040271534e-02, 9.938775510204082009e-01, 6.262856377729943524e+00], 
-[1.963040650040271534e-02, 9.959183673469387266e-01, 9.235313945023840176e+00], 
-[1.963040650040271534e-02, 9.979591836734693633e-01, 1.791204629164312934e+01], 
-[1.963040650040271534e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[2.154434690031884619e-02, 1.000000000000000021e-03, 2.605032214756553693e-02], 
-[2.154434690031884619e-02, 1.148922311909569708e-03, 2.603259254075943052e-02], 
-[2.154434690031884619e-02, 1.320022478803632065e-03, 2.601540984869633172e-02], 
-[2.154434690031884619e-02, 1.516603278119670137e-03, 2.599885589739142633e-02], 
-[2.154434690031884619e-02, 1.742459344546885402e-03, 2.598302490351778182e-02], 
-[2.154434690031884619e-02, 2.001950418545241171e-03, 2.596802539774074881e-02], 
-[2.154434690031884619e-02, 2.300085503203331758e-03, 2.595398246150772137e-02], 
-[2.154434690031884619e-02, 2.642619553930058204e-03, 2.594104033276421056e-02], 
-[2.154434690031884619e-02, 3.036164567398761706e-03, 2.592936544764490661e-02], 
-[2.154434690031884619e-02, 3.488317214113704091e-03, 2.591914999885829018e-02], 
-[2.154434690031884619e-02, 4.007805478313466660e-03, 2.591061610888296604e-02], 
-[2.154434690031884619e-02, 4.604657135827751671e-03, 2.590402073765502022e-02], 
-[2.154434690031884619e-02, 5.290393322046124149e-03, 2.589966147181355094e-02], 
-[2.154434690031884619e-02, 6.078250926476181683e-03, 2.589788337671756341e-02], 
-[2.154434690031884619e-02, 6.983438106813499684e-03, 2.589908713670836804e-02], 
-[2.154434690031884619e-02, 8.023427854757562983e-03, 2.590373876510153328e-02], 
-[2.154434690031884619e-02, 9.218295280327699903e-03, 2.591238123807388175e-02], 
-[2.154434690031884619e-02, 1.059110512533918171e-02, 2.592564850080060490e-02], 
-[2.154434690031884619e-02, 1.216835698628199354e-02, 2.594428241729175577e-02], 
-[2.154434690031884619e-02, 1.398049684082008047e-02, 2.596915339724760463e-02], 
-[2.154434690031884619e-02, 1.606250475199945058e-02, 2.600128564774570675e-02], 
-[2.154434690031884619e-02, 1.845457009472566828e-02, 2.604188828338768746e-02], 
-[2.154434690031884619e-02, 2.120286733852943389e-02, 2.609239391301674052e-02], 
-[2.154434690031884619e-02, 2.436044736169515681e-02, 2.615450684151855026e-02], 
-[2.154434690031884619e-02, 2.798826150195019707e-02, 2.623026373625814145e-02], 
-[2.154434690031884619e-02, 3.215633811115024138e-02, 2.632211058764092476e-02], 
-[2.154434690031884619e-02, 3.694513432520856594e-02, 2.643300115713527812e-02], 
-[2.154434690031884619e-02, 4.244708914272822542e-02, 2.656652402442355107e-02], 
-[2.154434690031884619e-02, 4.876840779169493850e-02, 2.672706807489922884e-02], 
-[2.154434690031884619e-02, 5.603111182818285713e-02, 2.692004020199486106e-02], 
-[2.154434690031884619e-02, 6.437539454049952259e-02, 2.715215474608197524e-02], 
-[2.154434690031884619e-02, 7.396232712556144451e-02, 2.743182271957890148e-02], 
-[2.154434690031884619e-02, 8.497696787531199003e-02, 2.776968173895555392e-02], 
-[2.154434690031884619e-02, 9.763193439036874088e-02, 2.817932738130831533e-02], 
-[2.154434690031884619e-02, 1.121715077759858903e-01, 2.867833778139892986e-02], 
-[2.154434690031884619e-02, 1.288763480443681220e-01, 2.928973330205244391e-02], 
-[2.154434690031884619e-02, 1.480689117455977755e-01, 3.004409571659865177e-02], 
-[2.154434690031884619e-02, 1.701196764046864207e-01, 3.098271191915610151e-02], 
-[2.154434690031884619e-02, 1.954542919161802172e-01, 3.216235470125780593e-02], 
-[2.154434690031884619e-02, 2.245617969409859638e-01, 3.366276631924293439e-02], 
-[2.154434690031884619e-02, 2.580040589080049296e-01, 3.559877866655281053e-02], 
-[2.154434690031884619e-02, 2.964266198426381838e-01, 3.814075705647305969e-02], 
-[2.154434690031884619e-02, 3.405711573811430193e-01, 4.155082494550568772e-02], 
-[2.154434690031884619e-02, 3.912898015080607528e-01, 4.625107500928637982e-02], 
-[2.154434690031884619e-02, 4.495615833752782953e-01, 5.296226892596628960e-02], 
-[2.154434690031884619e-02, 5.165113337172515529e-01, 6.301558953728661483e-02], 
-[2.154434690031884619e-02, 5.934313956619206021e-01, 7.915585332414248887e-02], 
-[2.154434690031884619e-02, 6.818065710636164178e-01, 1.080662234730091487e-01], 
-[2.154434690031884619e-02, 7.833427819015473803e-01, 1.713529110663744026e-01], 
-[2.154434690031884619e-02, 9.000000000000000222e-01, 4.010954115655209207e-01], 
-[2.154434690031884619e-02, 9.020408163265306589e-01, 4.098834077232839102e-01], 
-[2.154434690031884619e-02, 9.040816326530612956e-01, 4.190377069977794244e-01], 
-[2.154434690031884619e-02, 9.061224489795918213e-01, 4.285817938199509847e-01], 
-[2.154434690031884619e-02, 9.081632653061224580e-01, 4.385412135684257917e-01], 
-[2.154434690031884619e-02, 9.102040816326530948e-01, 4.489438043683018909e-01], 
-[2.154434690031884619e-02, 9.122448979591837315e-01, 4.598199609552667821e-01], 
-[2.154434690031884619e-02, 9.142857142857142572e-01, 4.712029359094159209e-01], 
-[2.154434690031884619e-02, 9.163265306122448939e-01, 4.831291845912428773e-01], 
-[2.154434690031884619e-02, 9.183673469387755306e-01, 4.956387613704922868e-01], 
-[2.154434690031884619e-02, 9.204081632653061673e-01, 5.087757762852143095e-01], 
-[2.154434690031884619e-02, 9.224489795918368040e-01, 5.225889231792787415e-01], 
-[2.154434690031884619e-02, 9.244897959183673297e-01, 5.371320927395359934e-01], 
-[2.154434690031884619e-02, 9.265306122448979664e-01, 5.524650868163729633e-01], 
-[2.154434690031884619e-02, 9.285714285714286031e-01, 5.686544541311879808e-01], 
-[2.154434690031884619e-02, 9.306122448979592399e-01, 5.857744721729528647e-01], 
-[2.154434690031884619e-02, 9.326530612244897656e-01, 6.039083060581045270e-01], 
-[2.154434690031884619e-02, 9.346938775510204023e-01, 6.231493827697429655e-01], 
-[2.154434690031884619e-02, 9.367346938775510390e-01, 6.436030290388565778e-01], 
-[2.154434690031884619e-02, 9.387755102040816757e-01, 6.653884339129906289e-01], 
-[2.154434690031884619e-02, 9.408163265306123124e-01, 6.886410137831200373e-01], 
-[2.154434690031884619e-02, 9.428571428571428381e-01, 7.135152797078294640e-01], 
-[2.154434690031884619e-02, 9.448979591836734748e-01, 7.401883362527214016e-01], 
-[2.154434690031884619e-02, 9.469387755102041115e-01, 7.688641805482108182e-01], 
-[2.154434690031884619e-02, 9.489795918367347483e-01, 7.997790238798307971e-01], 
-[2.154434690031884619e-02, 9.510204081632652739e-01, 8.332079317139442498e-01], 
-[2.154434690031884619e-02, 9.530612244897959107e-01, 8.694731802641176843e-01], 
-[2.154434690031884619e-02, 9.551020408163265474e-01, 9.089548714494173343e-01], 
-[2.154434690031884619e-02, 9.571428571428571841e-01, 9.521045530528634560e-01], 
-[2.154434690031884619e-02, 9.591836734693878208e-01, 9.994628874799188489e-01], 
-[2.154434690031884619e-02, 9.612244897959183465e-01, 1.051682848684440952e+00], 
-[2.154434690031884619e-02, 9.632653061224489832e-01, 1.109560579647941969e+00], 
-[2.154434690031884619e-02, 9.653061224489796199e-01, 1.174077038931216066e+00], 
-[2.154434690031884619e-02, 9.673469387755102566e-01, 1.246455117515525846e+00], 
-[2.154434690031884619e-02, 9.693877551020407823e-01, 1.328239385135796979e+00], 
-[2.154434690031884619e-02, 9.714285714285714191e-01, 1.421409685308634652e+00], 
-[2.154434690031884619e-02, 9.734693877551020558e-01, 1.528546649358300868e+00], 
-[2.154434690031884619e-02, 9.755102040816326925e-01, 1.653079152568565302e+00], 
-[2.154434690031884619e-02, 9.775510204081632182e-01, 1.799665396915533622e+00], 
-[2.154434690031884619e-02, 9.795918367346938549e-01, 1.974800316293892966e+00], 
-[2.154434690031884619e-02, 9.816326530612244916e-01, 2.187823709397741290e+00], 
-[2.154434690031884619e-02, 9.836734693877551283e-01, 2.452676411139991686e+00], 
-[2.154434690031884619e-02, 9.857142857142857650e-01, 2.791145198761456392e+00], 
-[2.154434690031884619e-02, 9.877551020408162907e-01, 3.239315495922578947e+00], 
-[2.154434690031884619e-02, 9.897959183673469274e-01, 3.861674171737678130e+00], 
-[2.154434690031884619e-02, 9.918367346938775642e-01, 4.786093984411699864e+00], 
-[2.154434690031884619e-02, 9.938775510204082009e-01, 6.307791560952024312e+00], 
-[2.154434690031884619e-02, 9.959183673469387266e-01, 9.299960378422497342e+00], 
-[2.154434690031884619e-02, 9.979591836734693633e-01, 1.803205863781943918e+01], 
-[2.154434690031884619e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[2.364489412645408295e-02, 1.000000000000000021e-03, 2.630432655031119185e-02], 
-[2.364489412645408295e-02, 1.148922311909569708e-03, 2.628622948479740484e-02], 
-[2.364489412645408295e-02, 1.320022478803632065e-03, 2.626868434023420934e-02], 
-[2.364489412645408295e-02, 1.516603278119670137e-03, 2.625177368743045886e-02], 
-[2.364489412645408295e-02, 1.742459344546885402e-03, 2.623559260002109733e-02], 
-[2.364489412645408295e-02, 2.001950418545241171e-03, 2.622025059512854764e-02], 
-[2.364489412645408295e-02, 2.300085503203331758e-03, 2.620587389028421199e-02], 
-[2.364489412645408295e-02, 2.642619553930058204e-03, 2.619260803259292059e-02], 
-[2.364489412645408295e-02, 3.036164567398761706e-03, 2.618062096777416109e-02], 
-[2.364489412645408295e-02, 3.488317214113704091e-03, 2.617010663052774661e-02], 
-[2.364489412645408295e-02, 4.007805478313466660e-03, 2.616128915521615320e-02], 
-[2.364489412645408295e-02, 4.604657135827751671e-03, 2.615442782761629587e-02], 
-[2.364489412645408295e-02, 5.290393322046124149e-03, 2.614982292610936593e-02], 
-[2.364489412645408295e-02, 6.078250926476181683e-03, 2.614782263515665062e-02], 
-[2.364489412645408295e-02, 6.983438106813499684e-03, 2.614883125853115914e-02], 
-[2.364489412645408295e-02, 8.023427854757562983e-03, 2.615331901630560396e-02], 
-[2.364489412645408295e-02, 9.218295280327699903e-03, 2.616183378291539463e-02], 
-[2.364489412645408295e-02, 1.059110512533918171e-02, 2.617501521864185055e-02], 
-[2.364489412645408295e-02, 1.216835698628199354e-02, 2.619361187104597699e-02], 
-[2.364489412645408295e-02, 1.398049684082008047e-02, 2.621850198618831326e-02], 
-[2.364489412645408295e-02, 1.606250475199945058e-02, 2.625071898585117081e-02], 
-[2.364489412645408295e-02, 1.845457009472566828e-02, 2.629148285533224050e-02], 
-[2.364489412645408295e-02, 2.120286733852943389e-02, 2.634223907423204059e-02], 
-[2.364489412645408295e-02, 2.436044736169515681e-02, 2.640470724764779759e-02], 
-[2.364489412645408295e-02, 2.798826150195019707e-02, 2.648094231246443664e-02], 
-[2.364489412645408295e-02, 3.215633811115024138e-02, 2.657341218195562182e-02], 
-[2.364489412645408295e-02, 3.694513432520856594e-02, 2.668509706768354764e-02], 
-[2.364489412645408295e-02, 4.244708914272822542e-02, 2.681961765275401796e-02], 
-[2.364489412645408295e-02, 4.876840779169493850e-02, 2.698140204379821314e-02], 
-[2.364489412645408295e-02, 5.603111182818285713e-02, 2.717590539648266634e-02], 
-[2.364489412645408295e-02, 6.437539454049952259e-02, 2.740990190640118021e-02], 
-[2.364489412645408295e-02, 7.396232712556144451e-02, 2.769187745879592849e-02], 
-[2.364489412645408295e-02, 8.497696787531199003e-02, 2.803256421254069625e-02], 
-[2.364489412645408295e-02, 9.763193439036874088e-02, 2.844567836094518548e-02], 
-[2.364489412645408295e-02, 1.121715077759858903e-01, 2.894895367664740080e-02], 
-[2.364489412645408295e-02, 1.288763480443681220e-01, 2.956561389212370231e-02], 
-[2.364489412645408295e-02, 1.480689117455977755e-01, 3.032651027649319389e-02], 
-[2.364489412645408295e-02, 1.701196764046864207e-01, 3.127329253923234048e-02], 
-[2.364489412645408295e-02, 1.954542919161802172e-01, 3.246323080672568195e-02], 
-[2.364489412645408295e-02, 2.245617969409859638e-01, 3.397676341992085514e-02], 
-[2.364489412645408295e-02, 2.580040589080049296e-01, 3.592972067101118938e-02], 
-[2.364489412645408295e-02, 2.964266198426381838e-01, 3.849394242472729821e-02], 
-[2.364489412645408295e-02, 3.405711573811430193e-01, 4.193380921559911045e-02], 
-[2.364489412645408295e-02, 3.912898015080607528e-01, 4.667502677217774676e-02], 
-[2.364489412645408295e-02, 4.495615833752782953e-01, 5.344448395966885923e-02], 
-[2.364489412645408295e-02, 5.165113337172515529e-01, 6.358458782933759657e-02], 
-[2.364489412645408295e-02, 5.934313956619206021e-01, 7.986306928067393729e-02], 
-[2.364489412645408295e-02, 6.818065710636164178e-01, 1.090181821702905368e-01], 
-[2.364489412645408295e-02, 7.833427819015473803e-01, 1.728311447873888684e-01], 
-[2.364489412645408295e-02, 9.000000000000000222e-01, 4.044191077397831791e-01], 
-[2.364489412645408295e-02, 9.020408163265306589e-01, 4.132762982370303817e-01], 
-[2.364489412645408295e-02, 9.040816326530612956e-01, 4.225025897224694016e-01], 
-[2.364489412645408295e-02, 9.061224489795918213e-01, 4.321216423237564386e-01], 
-[2.364489412645408295e-02, 9.081632653061224580e-01, 4.421591922937707642e-01], 
-[2.364489412645408295e-02, 9.102040816326530948e-01, 4.526432854946534912e-01], 
-[2.364489412645408295e-02, 9.122448979591837315e-01, 4.636045431777728876e-01], 
-[2.364489412645408295e-02, 9.142857142857142572e-01, 4.750764654017697319e-01], 
-[2.364489412645408295e-02, 9.163265306122448939e-01, 4.870957784661963386e-01], 
-[2.364489412645408295e-02, 9.183673469387755306e-01, 4.997028340053631390e-01], 
-[2.364489412645408295e-02, 9.204081632653061673e-01, 5.129420689445409742e-01], 
-[2.364489412645408295e-02, 9.224489795918368040e-01, 5.268625374450289778e-01], 
-[2.364489412645408295e-02, 9.244897959183673297e-01, 5.415185283541896766e-01], 
-[2.364489412645408295e-02, 9.265306122448979664e-01, 5.569702846598778567e-01], 
-[2.364489412645408295e-02, 9.285714285714286031e-01, 5.732848451945100621e-01], 
-[2.364489412645408295e-02, 9.306122448979592399e-01, 5.905370335655011349e-01], 
-[2.364489412645408295e-02, 9.326530612244897656e-01, 6.088106253025238335e-01], 
-[2.364489412645408295e-02, 9.346938775510204023e-01, 6.281997319070118380e-01], 
-[2.364489412645408295e-02, 9.367346938775510390e-01, 6.488104504045208998e-01], 
-[2.364489412645408295e-02, 9.387755102040816757e-01, 6.707628398719540641e-01], 
-[2.364489412645408295e-02, 9.408163265306123124e-01, 6.941933032528490033e-01], 
-[2.364489412645408295e-02, 9.428571428571428381e-01, 7.192574749947995283e-01], 
-[2.364489412645408295e-02, 9.448979591836734748e-01, 7.461337446245719374e-01], 
-[2.364489412645408295e-02, 9.469387755102041115e-01, 7.750275861335154115e-01], 
-[2.364489412645408295e-02, 9.489795918367347483e-01, 8.061769170250630001e-01], 
-[2.364489412645408295e-02, 9.510204081632652739e-01, 8.398587849692069618e-01], 
-[2.364489412645408295e-02, 9.530612244897959107e-01, 8.763977829099368622e-01], 
-[2.364489412645408295e-02, 9.551020408163265474e-01, 9.161767381980017166e-01], 
-[2.364489412645408295e-02, 9.571428571428571841e-01, 9.596504276725796867e-01], 
-[2.364489412645408295e-02, 9.591836734693878208e-01, 1.007363369219300475e+00], 
-[2.364489412645408295e-02, 9.612244897959183465e-01, 1.059973179450452996e+00], 
-[2.364489412645408295e-02, 9.632653061224489832e-01, 1.118281644375244133e+00], 
-[2.364489412645408295e-02, 9.653061224489796199e-01, 1.183276652759806868e+00], 
-[2.364489412645408295e-02, 9.673469387755102566e-01, 1.256189704982020983e+00], 
-[2.364489412645408295e-02, 9.693877551020407823e-01, 1.338576204723205709e+00], 
-[2.364489412645408295e-02, 9.714285714285714191e-01, 1.432429827858479277e+00], 
-[2.364489412645408295e-02, 9.734693877551020558e-01, 1.540349159423804348e+00], 
-[2.364489412645408295e-02, 9.755102040816326925e-01, 1.665786821266141304e+00], 
-[2.364489412645408295e-02, 9.775510204081632182e-01, 1.813433116658187405e+00], 
-[2.364489412645408295e-02, 9.795918367346938549e-01, 1.989827497810370271e+00], 
-[2.364489412645408295e-02, 9.816326530612244916e-01, 2.204373402957349626e+00], 
-[2.364489412645408295e-02, 9.836734693877551283e-01, 2.471106033546254466e+00], 
-[2.364489412645408295e-02, 9.857142857142857650e-01, 2.811958554677685740e+00], 
-[2.364489412645408295e-02, 9.877551020408162907e-01, 3.263256808641975759e+00], 
-[2.364489412645408295e-02, 9.897959183673469274e-01, 3.889913086090064365e+00], 
-[2.364489412645408295e-02, 9.918367346938775642e-01, 4.820633779570002275e+00], 
-[2.364489412645408295e-02, 9.938775510204082009e-01, 6.352531660905226474e+00], 
-[2.364489412645408295e-02, 9.959183673469387266e-01, 9.364296516197203601e+00], 
-[2.364489412645408295e-02, 9.979591836734693633e-01, 1.815139650307719421e+01], 
-[2.364489412645408295e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[2.595024211399737241e-02, 1.000000000000000021e-03, 2.655868274568486814e-02], 
-[2.595024211399737241e-02, 1.148922311909569708e-03, 2.654021425897305428e-02], 
-[2.595024211399737241e-02, 1.320022478803632065e-03, 2.652230270045909805e-02], 
-[2.595024211399737241e-02, 1.516603278119670137e-03, 2.650503138582794779e-02], 
-[2.595024211399737241e-02, 1.742459344546885402e-03, 2.648849624576075923e-02], 
-[2.595024211399737241e-02, 2.001950418545241171e-03, 2.647280778392178957e-02], 
-[2.595024211399737241e-02, 2.300085503203331758e-03, 2.645809335401043405e-02], 
-[2.595024211399737241e-02, 2.642619553930058204e-03, 2.644449981237152400e-02], 
-[2.595024211399737241e-02, 3.036164567398761706e-03, 2.643219661438418050e-02], 
-[2.595024211399737241e-02, 3.488317214113704091e-03, 2.642137943680489612e-02], 
-[2.595024211399737241e-02, 4.007805478313466660e-03, 2.641227442593168523e-02], 
-[2.595024211399737241e-02, 4.604657135827751671e-03, 2.640514319341413091e-02], 
-[2.595024211399737241e-02, 5.290393322046124149e-03, 2.640028870938104094e-02], 
-[2.595024211399737241e-02, 6.078250926476181683e-03, 2.639806227736578997e-02], 
-[2.595024211399737241e-02, 6.983438106813499684e-03, 2.639887182049596021e-02], 
-[2.595024211399737241e-02, 8.023427854757562983e-03, 2.640319176546310556e-02], 
-[2.595024211399737241e-02, 9.218295280327699903e-03, 2.641157488474358758e-02], 
-[2.595024211399737241e-02, 1.059110512533918171e-02, 2.642466655340487691e-02], 
-[2.595024211399737241e-02, 1.216835698628199354e-02, 2.644322200210716400e-02], 
-[2.595024211399737241e-02, 1.398049684082008047e-02, 2.646812731264953228e-02], 
-[2.595024211399737241e-02, 1.606250475199945058e-02, 2.650042512067836420e-02], 
-[2.595024211399737241e-02, 1.845457009472566828e-02, 2.654134628106313148e-02], 
-[2.595024211399737241e-02, 2.120286733852943389e-02, 2.659234914266866284e-02], 
-[2.595024211399737241e-02, 2.436044736169515681e-02, 2.665516860882872346e-02], 
-[2.595024211399737241e-02, 2.798826150195019707e-02, 2.673187788333823700e-02], 
-[2.595024211399737241e-02, 3.215633811115024138e-02, 2.682496679888679569e-02], 
-[2.595024211399737241e-02, 3.694513432520856594e-02, 2.693744201255020981e-02], 
-[2.595024211399737241e-02, 4.244708914272822542e-02, 2.707295630475321097e-02], 
-[2.595024211399737241e-02, 4.876840779169493850e-02, 2.723597699517910434e-02], 
-[2.595024211399737241e-02, 5.603111182818285713e-02, 2.743200749067107105e-02], 
-[2.595024211399737241e-02, 6.437539454049952259e-02, 2.766788182698039222e-02], 
-[2.595024211399737241e-02, 7.396232712556144451e-02, 2.795216074144950963e-02], 
-[2.595024211399737241e-02, 8.497696787531199003e-02, 2.829567090654279415e-02], 
-[2.595024211399737241e-02, 9.763193439036874088e-02, 2.871224909124620028e-02], 
-[2.595024211399737241e-02, 1.121715077759858903e-01, 2.921978464831896660e-02], 
-[2.595024211399737241e-02, 1.288763480443681220e-01, 2.984170459643001663e-02], 
-[2.595024211399737241e-02, 1.480689117455977755e-01, 3.060912957801733073e-02], 
-[2.595024211399737241e-02, 1.701196764046864207e-01, 3.156407193507881903e-02], 
-[2.595024211399737241e-02, 1.954542919161802172e-01, 3.276429885053823432e-02], 
-[2.595024211399737241e-02, 2.245617969409859638e-01, 3.429094431673419124e-02], 
-[2.595024211399737241e-02, 2.580040589080049296e-01, 3.626083633241383025e-02], 
-[2.595024211399737241e-02, 2.964266198426381838e-01, 3.884728817263287393e-02], 
-[2.595024211399737241e-02, 3.405711573811430193e-01, 4.231693549545595401e-02], 
-[2.595024211399737241e-02, 3.912898015080607528e-01, 4.709909357032223548e-02], 
-[2.595024211399737241e-02, 4.495615833752782953e-01, 5.392677173530825707e-02], 
-[2.595024211399737241e-02, 5.165113337172515529e-01, 6.415358730274242638e-02], 
-[2.595024211399737241e-02, 5.934313956619206021e-01, 8.057015301105195648e-02], 
-[2.595024211399737241e-02, 6.818065710636164178e-01, 1.099697224904440940e-01], 
-[2.595024211399737241e-02, 7.833427819015473803e-01, 1.743081771146343384e-01], 
-[2.595024211399737241e-02, 9.000000000000000222e-01, 4.077377104708334032e-01], 
-[2.595024211399737241e-02, 9.020408163265306589e-01, 4.166639243258020153e-01], 
-[2.595024211399737241e-02, 9.040816326530612956e-01, 4.259620285676107287e-01], 
-[2.595024211399737241e-02, 9.061224489795918213e-01, 4.356558584217363195e-01], 
-[2.595024211399737241e-02, 9.081632653061224580e-01, 4.457713403602876490e-01], 
-[2.595024211399737241e-02, 9.102040816326530948e-01, 4.563367272646654538e-01], 
-[2.595024211399737241e-02, 9.122448979591837315e-01, 4.673828661137913176e-01], 
-[2.595024211399737241e-02, 9.142857142857142572e-01, 4.789435035776770655e-01], 
-[2.595024211399737241e-02, 9.163265306122448939e-01, 4.910556359387014957e-01], 
-[2.595024211399737241e-02, 9.183673469387755306e-01, 5.037599110388898405e-01], 
-[2.595024211399737241e-02, 9.204081632653061673e-01, 5.171010915198733793e-01], 
-[2.595024211399737241e-02, 9.224489795918368040e-01, 5.311285905599434365e-01], 
-[2.595024211399737241e-02, 9.244897959183673297e-01, 5.458970937187901384e-01], 
-[2.595024211399737241e-02, 9.265306122448979664e-01, 5.614672835045227961e-01], 
-[2.595024211399737241e-02, 9.285714285714286031e-01, 5.779066870492959307e-01], 
-[2.595024211399737241e-02, 9.306122448979592399e-01, 5.952906720440325206e-01], 
-[2.595024211399737241e-02, 9.326530612244897656e-01, 6.137036221379370549e-01], 
-[2.595024211399737241e-02, 9.346938775510204023e-01, 6.332403307564143935e-01], 
-[2.595024211399737241e-02, 9.367346938775510390e-01, 6.540076622743404844e-01], 
-[2.595024211399737241e-02, 9.387755102040816757e-01, 6.761265424412957747e-01], 
-[2.595024211399737241e-02, 9.408163265306123124e-01, 6.997343569118393836e-01], 
-[2.595024211399737241e-02, 9.428571428571428381e-01, 7.249878591065822553e-01], 
-[2.595024211399737241e-02, 9.448979591836734748e-01, 7.520667184129659066e-01], 
-[2.595024211399737241e-02, 9.469387755102041115e-01, 7.811778797621625747e-01], 
-[2.595024211399737241e-02, 9.489795918367347483e-01, 8.125609599640988279e-01], 
-[2.595024211399737241e-02, 9.510204081632652739e-01, 8.464949807774754253e-01], 
-[2.595024211399737241e-02, 9.530612244897959107e-01, 8.833068422879613024e-01], 
-[2.595024211399737241e-02, 9.551020408163265474e-01, 9.233820858694634648e-01], 
-[2.595024211399737241e-02, 9.571428571428571841e-01, 9.671787037416779143e-01], 
-[2.595024211399737241e-02, 9.591836734693878208e-01, 1.015245052742582699e+00], 
-[2.595024211399737241e-02, 9.612244897959183465e-01, 1.068243371988497836e+00], 
-[2.595024211399737241e-02, 9.632653061224489832e-01, 1.126981065696207818e+00], 
-[2.595024211399737241e-02, 9.653061224489796199e-01, 1.192452921936330235e+00], 
-[2.595024211399737241e-02, 9.673469387755102566e-01, 1.265899011542977348e+00], 
-[2.595024211399737241e-02, 9.693877551020407823e-01, 1.348885522402409443e+00], 
-[2.595024211399737241e-02, 9.714285714285714191e-01, 1.443419898231880438e+00], 
-[2.595024211399737241e-02, 9.734693877551020558e-01, 1.552118592635593153e+00], 
-[2.595024211399737241e-02, 9.755102040816326925e-01, 1.678457859404878683e+00], 
-[2.595024211399737241e-02, 9.775510204081632182e-01, 1.827159945225673265e+00], 
-[2.595024211399737241e-02, 9.795918367346938549e-01, 2.004808597218394883e+00], 
-[2.595024211399737241e-02, 9.816326530612244916e-01, 2.220870566785598577e+00], 
-[2.595024211399737241e-02, 9.836734693877551283e-01, 2.489474926384528608e+00], 
-[2.595024211399737241e-02, 9.857142857142857650e-01, 2.832700440060633262e+00], 
-[2.595024211399737241e-02, 9.877551020408162907e-01, 3.287112035036352076e+00], 
-[2.595024211399737241e-02, 9.897959183673469274e-01, 3.918044984808032982e+00], 
-[2.595024211399737241e-02, 9.918367346938775642e-01, 4.855034351700266093e+00], 
-[2.595024211399737241e-02, 9.938775510204082009e-01, 6.397077227396401611e+00], 
-[2.595024211399737241e-02, 9.959183673469387266e-01, 9.428323324814837036e+00], 
-[2.595024211399737241e-02, 9.979591836734693633e-01, 1.827006233110202160e+01], 
-[2.595024211399737241e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[2.848035868435801893e-02, 1.000000000000000021e-03, 2.681339097814842976e-02], 
-[2.848035868435801893e-02, 1.148922311909569708e-03, 2.679454710092433328e-02], 
-[2.848035868435801893e-02, 1.320022478803632065e-03, 2.677626516017643857e-02], 
-[2.848035868435801893e-02, 1.516603278119670137e-03, 2.675862921654707099e-02], 
-[2.848035868435801893e-02, 1.742459344546885402e-03, 2.674173605784654212e-02], 
-[2.848035868435801893e-02, 2.001950418545241171e-03, 2.672569717436410613e-02], 
-[2.848035868435801893e-02, 2.300085503203331758e-03, 2.671064105604932862e-02], 
-[2.848035868435801893e-02, 2.642619553930058204e-03, 2.669671586856557643e-02], 
-[2.848035868435801893e-02, 3.036164567398761706e-03, 2.668409257702402185e-02], 
-[2.848035868435801893e-02, 3.488317214113704091e-03, 2.667296860030050898e-02], 
-[2.848035868435801893e-02, 4.007805478313466660e-03, 2.666357209667697195e-02], 
-[2.848035868435801893e-02, 4.604657135827751671e-03, 2.665616700370396219e-02], 
-[2.848035868435801893e-02, 5.290393322046124149e-03, 2.665105898325918071e-02], 
-[2.848035868435801893e-02, 6.078250926476181683e-03, 2.664860245791305510e-02], 
-[2.848035868435801893e-02, 6.983438106813499684e-03, 2.664920897006502198e-02], 
-[2.848035868435801893e-02, 8.023427854757562983e-03, 2.665335715288073143e-02], 
-[2.848035868435801893e-02, 9.218295280327699903e-03, 2.666160467665239925e-02], 
-[2.848035868435801893e-02, 1.059110512533918171e-02, 2.667460263090500050e-02], 
-[2.848035868435801893e-02, 1.216835698628199354e-02, 2.669311292893603721e-02], 
-[2.848035868435801893e-02, 1.398049684082008047e-02, 2.671802948764968530e-02], 
-[2.848035868435801893e-02, 1.606250475199945058e-02, 2.675040415570201224e-02], 
-[2.848035868435801893e-02, 1.845457009472566828e-02, 2.679147865639389461e-02], 
-[2.848035868435801893e-02, 2.120286733852943389e-02, 2.684272420634264272e-02], 
-[2.848035868435801893e-02, 2.436044736169515681e-02, 2.690589100512116513e-02], 
-[2.848035868435801893e-02, 2.798826150195019707e-02, 2.698307052079815943e-02], 
-[2.848035868435801893e-02, 3.215633811115024138e-02, 2.707677450199545005e-02], 
-[2.848035868435801893e-02, 3.694513432520856594e-02, 2.719003604668482343e-02], 
-[2.848035868435801893e-02, 4.244708914272822542e-02, 2.732654002646042746e-02], 
-[2.848035868435801893e-02, 4.876840779169493850e-02, 2.749079296581789442e-02], 
-[2.848035868435801893e-02, 5.603111182818285713e-02, 2.768834651165389196e-02], 
-[2.848035868435801893e-02, 6.437539454049952259e-02, 2.792609452473205495e-02], 
-[2.848035868435801893e-02, 7.396232712556144451e-02, 2.821267257367279443e-02], 
-[2.848035868435801893e-02, 8.497696787531199003e-02, 2.855900181559406156e-02], 
-[2.848035868435801893e-02, 9.763193439036874088e-02, 2.897903955447354851e-02], 
-[2.848035868435801893e-02, 1.121715077759858903e-01, 2.949083066524062213e-02], 
-[2.848035868435801893e-02, 1.288763480443681220e-01, 3.011800536905741635e-02], 
-[2.848035868435801893e-02, 1.480689117455977755e-01, 3.089195355890089756e-02], 
-[2.848035868435801893e-02, 1.701196764046864207e-01, 3.185505002605588248e-02], 
-[2.848035868435801893e-02, 1.954542919161802172e-01, 3.306555873114916388e-02], 
-[2.848035868435801893e-02, 2.245617969409859638e-01, 3.460530888401881083e-02], 
-[2.848035868435801893e-02, 2.580040589080049296e-01, 3.659212549686834820e-02], 
-[2.848035868435801893e-02, 2.964266198426381838e-01, 3.920079411275639164e-02], 
-[2.848035868435801893e-02, 3.405711573811430193e-01, 4.270020355721895061e-02], 
-[2.848035868435801893e-02, 3.912898015080607528e-01, 4.752327512653242714e-02], 
-[2.848035868435801893e-02, 4.495615833752782953e-01, 5.440913191511247138e-02], 
-[2.848035868435801893e-02, 5.165113337172515529e-01, 6.472258754619446275e-02], 
-[2.848035868435801893e-02, 5.934313956619206021e-01, 8.127710402133321577e-02], 
-[2.848035868435801893e-02, 6.818065710636164178e-01, 1.109208438827826021e-01], 
-[2.848035868435801893e-02, 7.833427819015473803e-01, 1.757840077119250388e-01], 
-[2.848035868435801893e-02, 9.000000000000000222e-01, 4.110512231036837494e-01], 
-[2.848035868435801893e-02, 9.020408163265306589e-01, 4.200462895485636561e-01], 
-[2.848035868435801893e-02, 9.040816326530612956e-01, 4.294160273200074984e-01], 
-[2.848035868435801893e-02, 9.061224489795918213e-01, 4.391844461435626679e-01], 
-[2.848035868435801893e-02, 9.081632653061224580e-01, 4.493776620568052937e-01], 
-[2.848035868435801893e-02, 9.102040816326530948e-01, 4.600241342440068437e-01], 
-[2.848035868435801893e-02, 9.122448979591837315e-01, 4.711549346250588632e-01], 
-[2.848035868435801893e-02, 9.142857142857142572e-01, 4.828040556158862406e-01], 
-[2.848035868435801893e-02, 9.163265306122448939e-01, 4.950087625273717484e-01], 
-[2.848035868435801893e-02, 9.183673469387755306e-01, 5.078099983545368845e-01], 
-[2.848035868435801893e-02, 9.204081632653061673e-01, 5.212528502868980507e-01], 
-[2.848035868435801893e-02, 9.224489795918368040e-01, 5.353870892219751987e-01], 
-[2.848035868435801893e-02, 9.244897959183673297e-01, 5.502677959866121293e-01], 
-[2.848035868435801893e-02, 9.265306122448979664e-01, 5.659560909953540442e-01], 
-[2.848035868435801893e-02, 9.285714285714286031e-01, 5.825199878726537994e-01], 
-[2.848035868435801893e-02, 9.306122448979592399e-01, 6.000353963623699105e-01], 
-[2.848035868435801893e-02, 9.326530612244897656e-01, 6.185873059445040623e-01], 
-[2.848035868435801893e-02, 9.346938775510204023e-01, 6.382711893797501368e-01], 
-[2.848035868435801893e-02, 9.367346938775510390e-01, 6.591946754535793485e-01], 
-[2.848035868435801893e-02, 9.387755102040816757e-01, 6.814795532390846011e-01], 
-[2.848035868435801893e-02, 9.408163265306123124e-01, 7.052641872690084135e-01], 
-[2.848035868435801893e-02, 9.428571428571428381e-01, 7.307064455311051976e-01], 
-[2.848035868435801893e-02, 9.448979591836734748e-01, 7.579872721848330830e-01], 
-[2.848035868435801893e-02, 9.469387755102041115e-01, 7.873150771939767534e-01], 
-[2.848035868435801893e-02, 9.489795918367347483e-01, 8.189311697799788181e-01], 
-[2.848035868435801893e-02, 9.510204081632652739e-01, 8.531165376948646184e-01], 
-[2.848035868435801893e-02, 9.530612244897959107e-01, 8.902003786006305042e-01], 
-[2.848035868435801893e-02, 9.551020408163265474e-01, 9.305709365140317768e-01], 
-[2.848035868435801893e-02, 9.571428571428571841e-01, 9.746894053938942593e-01], 
-[2.848035868435801893e-02, 9.591836734693878208e-01, 1.023107964544778259e+00], 
-[2.848035868435801893e-02, 9.612244897959183465e-01, 1.076493455484630601e+00], 
-[2.848035868435801893e-02, 9.632653061224489832e-01, 1.135658875882714192e+00], 
-[2.848035868435801893e-02, 9.653061224489796199e-01, 1.201605882295509797e+00], 
-[2.848035868435801893e-02, 9.673469387755102566e-01, 1.275583077178304992e+00], 
-[2.848035868435801893e-02, 9.693877551020407823e-01, 1.359167383017689357e+00], 
-[2.848035868435801893e-02, 9.714285714285714191e-01, 1.454379947037345744e+00], 
-[2.848035868435801893e-02, 9.734693877551020558e-01, 1.563855006509134782e+00], 
-[2.848035868435801893e-02, 9.755102040816326925e-01, 1.691092332883348259e+00], 
-[2.848035868435801893e-02, 9.775510204081632182e-01, 1.840845958844603114e+00], 
-[2.848035868435801893e-02, 9.795918367346938549e-01, 2.019743703695623616e+00], 
-[2.848035868435801893e-02, 9.816326530612244916e-01, 2.237315306648087976e+00], 
-[2.848035868435801893e-02, 9.836734693877551283e-01, 2.507783217223917838e+00], 
-[2.848035868435801893e-02, 9.857142857142857650e-01, 2.853371012081495905e+00], 
-[2.848035868435801893e-02, 9.877551020408162907e-01, 3.310881374177816916e+00], 
-[2.848035868435801893e-02, 9.897959183673469274e-01, 3.946070129674286164e+00], 
-[2.848035868435801893e-02, 9.918367346938775642e-01, 4.889296064114109441e+00], 
-[2.848035868435801893e-02, 9.938775510204082009e-01, 6.441428808995125266e+00], 
-[2.848035868435801893e-02, 9.959183673469387266e-01, 9.492041768299959159e+00], 
-[2.848035868435801893e-02, 9.979591836734693633e-01, 1.838805855827723690e+01], 
-[2.848035868435801893e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[3.125715849688236875e-02, 1.000000000000000021e-03, 2.706845149223480185e-02], 
-[3.125715849688236875e-02, 1.148922311909569708e-03, 2.704922824835607337e-02], 
-[3.125715849688236875e-02, 1.320022478803632065e-03, 2.703057195025447904e-02], 
-[3.125715849688236875e-02, 1.516603278119670137e-03, 2.701256740362580067e-02], 
-[3.125715849688236875e-02, 1.742459344546885402e-03, 2.699531225344285051e-02], 
-[3.125715849688236875e-02, 2.001950418545241171e-03, 2.697891897674969952e-02], 
-[3.125715849688236875e-02, 2.300085503203331758e-03, 2.696351719981023021e-02], 
-[3.125715849688236875e-02, 2.642619553930058204e-03, 2.694925639768291914e-02], 
-[3.125715849688236875e-02, 3.036164567398761706e-03, 2.693630904528097891e-02], 
-[3.125715849688236875e-02, 3.488317214113704091e-03, 2.692487430365948092e-02], 
-[3.125715849688236875e-02, 4.007805478313466660e-03, 2.691518234312950675e-02], 
-[3.125715849688236875e-02, 4.604657135827751671e-03, 2.690749942716720577e-02], 
-[3.125715849688236875e-02, 5.290393322046124149e-03, 2.690213390939628219e-02], 
-[3.125715849688236875e-02, 6.078250926476181683e-03, 2.689944333138430399e-02], 
-[3.125715849688236875e-02, 6.983438106813499684e-03, 2.689984285471432729e-02], 
-[3.125715849688236875e-02, 8.023427854757562983e-03, 2.690381531887484079e-02], 
-[3.125715849688236875e-02, 9.218295280327699903e-03, 2.691192329174136449e-02], 
-[3.125715849688236875e-02, 1.059110512533918171e-02, 2.692482357695907130e-02], 
-[3.125715849688236875e-02, 1.216835698628199354e-02, 2.694328476999083288e-02], 
-[3.125715849688236875e-02, 1.398049684082008047e-02, 2.696820862220073237e-02], 
-[3.125715849688236875e-02, 1.606250475199945058e-02, 2.700065619438641804e-02], 
-[3.125715849688236875e-02, 1.845457009472566828e-02, 2.704188007712372832e-02], 
-[3.125715849688236875e-02, 2.120286733852943389e-02, 2.709336435325171086e-02], 
-[3.125715849688236875e-02, 2.436044736169515681e-02, 2.715687451656282128e-02], 
-[3.125715849688236875e-02, 2.798826150195019707e-02, 2.723452029673689712e-02], 
-[3.125715849688236875e-02, 3.215633811115024138e-02, 2.732883535481296991e-02], 
-[3.125715849688236875e-02, 3.694513432520856594e-02, 2.744287922500369611e-02], 
-[3.125715849688236875e-02, 4.244708914272822542e-02, 2.758036886387828582e-02], 
-[3.125715849688236875e-02, 4.876840779169493850e-02, 2.774584999245058997e-02], 
-[3.125715849688236875e-02, 5.603111182818285713e-02, 2.794492248648191082e-02], 
-[3.125715849688236875e-02, 6.437539454049952259e-02, 2.818454001652382149e-02], 
-[3.125715849688236875e-02, 7.396232712556144451e-02, 2.847341296155073836e-02], 
-[3.125715849688236875e-02, 8.497696787531199003e-02, 2.882255693427901444e-02], 
-[3.125715849688236875e-02, 9.763193439036874088e-02, 2.924604973283794970e-02], 
-[3.125715849688236875e-02, 1.121715077759858903e-01, 2.976209169618745931e-02], 
-[3.125715849688236875e-02, 1.288763480443681220e-01, 3.039451616404070800e-02], 
-[3.125715849688236875e-02, 1.480689117455977755e-01, 3.117498215682543150e-02], 
-[3.125715849688236875e-02, 1.701196764046864207e-01, 3.214622673147634474e-02], 
-[3.125715849688236875e-02, 1.954542919161802172e-01, 3.336701034697788643e-02], 
-[3.125715849688236875e-02, 2.245617969409859638e-01, 3.491985699608782939e-02], 
-[3.125715849688236875e-02, 2.580040589080049296e-01, 3.692358801046959071e-02], 
-[3.125715849688236875e-02, 2.964266198426381838e-01, 3.955446005768216422e-02], 
-[3.125715849688236875e-02, 3.405711573811430193e-01, 4.308361317308641303e-02], 
-[3.125715849688236875e-02, 3.912898015080607528e-01, 4.794757116373637995e-02], 
-[3.125715849688236875e-02, 4.495615833752782953e-01, 5.489156416151905887e-02], 
-[3.125715849688236875e-02, 5.165113337172515529e-01, 6.529158814875028749e-02], 
-[3.125715849688236875e-02, 5.934313956619206021e-01, 8.198392181820231273e-02], 
-[3.125715849688236875e-02, 6.818065710636164178e-01, 1.118715457977385169e-01], 
-[3.125715849688236875e-02, 7.833427819015473803e-01, 1.772586362451883946e-01], 
-[3.125715849688236875e-02, 9.000000000000000222e-01, 4.143596489863516918e-01], 
-[3.125715849688236875e-02, 9.020408163265306589e-01, 4.234233974672172995e-01], 
-[3.125715849688236875e-02, 9.040816326530612956e-01, 4.328645897693218503e-01], 
-[3.125715849688236875e-02, 9.061224489795918213e-01, 4.427074095216735339e-01], 
-[3.125715849688236875e-02, 9.081632653061224580e-01, 4.529781616748130846e-01], 
-[3.125715849688236875e-02, 9.102040816326530948e-01, 4.637055110008860837e-01], 
-[3.125715849688236875e-02, 9.122448979591837315e-01, 4.749207535757131171e-01], 
-[3.125715849688236875e-02, 9.142857142857142572e-01, 4.866581266973883380e-01], 
-[3.125715849688236875e-02, 9.163265306122448939e-01, 4.989551637528843453e-01], 
-[3.125715849688236875e-02, 9.183673469387755306e-01, 5.118531018376286656e-01], 
-[3.125715849688236875e-02, 9.204081632653061673e-01, 5.253973515229295455e-01], 
-[3.125715849688236875e-02, 9.224489795918368040e-01, 5.396380401304439189e-01], 
-[3.125715849688236875e-02, 9.244897959183673297e-01, 5.546306423120002105e-01], 
-[3.125715849688236875e-02, 9.265306122448979664e-01, 5.704367147781516101e-01], 
-[3.125715849688236875e-02, 9.285714285714286031e-01, 5.871247558420449320e-01], 
-[3.125715849688236875e-02, 9.306122448979592399e-01, 6.047712152742590330e-01], 
-[3.125715849688236875e-02, 9.326530612244897656e-01, 6.234616861018178469e-01], 
-[3.125715849688236875e-02, 9.346938775510204023e-01, 6.432923178376971363e-01], 
-[3.125715849688236875e-02, 9.367346938775510390e-01, 6.643715007457495769e-01], 
-[3.125715849688236875e-02, 9.387755102040816757e-01, 6.868218838809223570e-01], 
-[3.125715849688236875e-02, 9.408163265306123124e-01, 7.107828068299888447e-01], 
-[3.125715849688236875e-02, 9.428571428571428381e-01, 7.364132477520810571e-01], 
-[3.125715849688236875e-02, 9.448979591836734748e-01, 7.638954205018235744e-01], 
-[3.125715849688236875e-02, 9.469387755102041115e-01, 7.934391941822809269e-01], 
-[3.125715849688236875e-02, 9.489795918367347483e-01, 8.252875635478365002e-01], 
-[3.125715849688236875e-02, 9.510204081632652739e-01, 8.597234742679628061e-01], 
-[3.125715849688236875e-02, 9.530612244897959107e-01, 8.970784120389811989e-01], 
-[3.125715849688236875e-02, 9.551020408163265474e-01, 9.377433121683369510e-01], 
-[3.125715849688236875e-02, 9.571428571428571841e-01, 9.821825567468320806e-01], 
-[3.125715849688236875e-02, 9.591836734693878208e-01, 1.030952131101780189e+00], 
-[3.125715849688236875e-02, 9.612244897959183465e-01, 1.084723459102258980e+00], 
-[3.125715849688236875e-02, 9.632653061224489832e-01, 1.144315107179810109e+00], 
-[3.125715849688236875e-02, 9.653061224489796199e-01, 1.210735569640226217e+00], 
-[3.125715849688236875e-02, 9.673469387755102566e-01, 1.285241941830034484e+00], 
-[3.125715849688236875e-02, 9.693877551020407823e-01, 1.369421831368112574e+00], 
-[3.125715849688236875e-02, 9.714285714285714191e-01, 1.465310024829146851e+00], 
-[3.125715849688236875e-02, 9.734693877551020558e-01, 1.575558458494449310e+00], 
-[3.125715849688236875e-02, 9.755102040816326925e-01, 1.703690307520541403e+00], 
-[3.125715849688236875e-02, 9.775510204081632182e-01, 1.854491233643942305e+00], 
-[3.125715849688236875e-02, 9.795918367346938549e-01, 2.034632906298398325e+00], 
-[3.125715849688236875e-02, 9.816326530612244916e-01, 2.253707728157540835e+00], 
-[3.125715849688236875e-02, 9.836734693877551283e-01, 2.526031033437301954e+00], 
-[3.125715849688236875e-02, 9.857142857142857650e-01, 2.873970427653583570e+00], 
-[3.125715849688236875e-02, 9.877551020408162907e-01, 3.334565024788795462e+00], 
-[3.125715849688236875e-02, 9.897959183673469274e-01, 3.973988781976681040e+00], 
-[3.125715849688236875e-02, 9.918367346938775642e-01, 4.923419279378292934e+00], 
-[3.125715849688236875e-02, 9.938775510204082009e-01, 6.485586953036001745e+00], 
-[3.125715849688236875e-02, 9.959183673469387266e-01, 9.555452808239886409e+00], 
-[3.125715849688236875e-02, 9.979591836734693633e-01, 1.850538761370334129e+01], 
-[3.125715849688236875e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[3.430469286314918875e-02, 1.000000000000000021e-03, 2.732386453254792916e-02], 
-[3.430469286314918875e-02, 1.148922311909569708e-03, 2.730425793904005249e-02], 
-[3.430469286314918875e-02, 1.320022478803632065e-03, 2.728522330162430620e-02], 
-[3.430469286314918875e-02, 1.516603278119670137e-03, 2.726684617111146264e-02], 
-[3.430469286314918875e-02, 1.742459344546885402e-03, 2.724922504976872578e-02], 
-[3.430469286314918875e-02, 2.001950418545241171e-03, 2.723247340142325584e-02], 
-[3.430469286314918875e-02, 2.300085503203331758e-03, 2.721672198874895351e-02], 
-[3.430469286314918875e-02, 2.642619553930058204e-03, 2.720212159627379694e-02], 
-[3.430469286314918875e-02, 3.036164567398761706e-03, 2.718884620878062736e-02], 
-[3.430469286314918875e-02, 3.488317214113704091e-03, 2.717709672956088868e-02], 
-[3.430469286314918875e-02, 4.007805478313466660e-03, 2.716710534099685270e-02], 
-[3.430469286314918875e-02, 4.604657135827751671e-03, 2.715914063251127775e-02], 
-[3.430469286314918875e-02, 5.290393322046124149e-03, 2.715351364946674839e-02], 
-[3.430469286314918875e-02, 6.078250926476181683e-03, 2.715058505238326578e-02], 
-[3.430469286314918875e-02, 6.983438106813499684e-03, 2.715077362193361182e-02], 
-[3.430469286314918875e-02, 8.023427854757562983e-03, 2.715456640377150038e-02], 
-[3.430469286314918875e-02, 9.218295280327699903e-03, 2.716253086311568032e-02], 
-[3.430469286314918875e-02, 1.059110512533918171e-02, 2.717532951738557689e-02], 
-[3.430469286314918875e-02, 1.216835698628199354e-02, 2.719373764372736563e-02], 
-[3.430469286314918875e-02, 1.398049684082008047e-02, 2.721866482730820463e-02], 
-[3.430469286314918875e-02, 1.606250475199945058e-02, 2.725118134018545552e-02], 
-[3.430469286314918875e-02, 1.845457009472566828e-02, 2.729255063903742937e-02], 
-[3.430469286314918875e-02, 2.120286733852943389e-02, 2.734426967137533471e-02], 
-[3.430469286314918875e-02, 2.436044736169515681e-02, 2.740811922316924859e-02], 
-[3.430469286314918875e-02, 2.798826150195019707e-02, 2.748622728302123688e-02], 
-[3.430469286314918875e-02, 3.215633811115024138e-02, 2.758114942084113203e-02], 
-[3.430469286314918875e-02, 3.694513432520856594e-02, 2.769597160238998490e-02], 
-[3.430469286314918875e-02, 4.244708914272822542e-02, 2.783444286297272890e-02], 
-[3.430469286314918875e-02, 4.876840779169493850e-02, 2.800114811177326427e-02], 
-[3.430469286314918875e-02, 5.603111182818285713e-02, 2.820173544216290906e-02], 
-[3.430469286314918875e-02, 6.437539454049952259e-02, 2.844321831917443616e-02], 
-[3.430469286314918875e-02, 7.396232712556144451e-02, 2.873438191112010626e-02], 
-[3.430469286314918875e-02, 8.497696787531199003e-02, 2.908633625713121645e-02], 
-[3.430469286314918875e-02, 9.763193439036874088e-02, 2.951327960849934803e-02], 
-[3.430469286314918875e-02, 1.121715077759858903e-01, 3.003356770988272265e-02], 
-[3.430469286314918875e-02, 1.288763480443681220e-01, 3.067123693536352377e-02], 
-[3.430469286314918875e-02, 1.480689117455977755e-01, 3.145821530942118083e-02], 
-[3.430469286314918875e-02, 1.701196764046864207e-01, 3.243760197061110184e-02], 
-[3.430469286314918875e-02, 1.954542919161802172e-01, 3.366865359640506400e-02], 
-[3.430469286314918875e-02, 2.245617969409859638e-01, 3.523458852722672480e-02], 
-[3.430469286314918875e-02, 2.580040589080049296e-01, 3.725522371930678478e-02], 
-[3.430469286314918875e-02, 2.964266198426381838e-01, 3.990828582000754965e-02], 
-[3.430469286314918875e-02, 3.405711573811430193e-01, 4.346716411531351132e-02], 
-[3.430469286314918875e-02, 3.912898015080607528e-01, 4.837198140497761534e-02], 
-[3.430469286314918875e-02, 4.495615833752782953e-01, 5.537406813717515863e-02], 
-[3.430469286314918875e-02, 5.165113337172515529e-01, 6.586058869982955311e-02], 
-[3.430469286314918875e-02, 5.934313956619206021e-01, 8.269060590897138463e-02], 
-[3.430469286314918875e-02, 6.818065710636164178e-01, 1.128218276868627329e-01], 
-[3.430469286314918875e-02, 7.833427819015473803e-01, 1.787320623824615318e-01], 
-[3.430469286314918875e-02, 9.000000000000000222e-01, 4.176629914698443136e-01], 
-[3.430469286314918875e-02, 9.020408163265306589e-01, 4.267952516465861601e-01], 
-[3.430469286314918875e-02, 9.040816326530612956e-01, 4.363077197080573177e-01], 
-[3.430469286314918875e-02, 9.061224489795918213e-01, 4.462247525912565460e-01], 
-[3.430469286314918875e-02, 9.081632653061224580e-01, 4.565728435084441816e-01], 
-[3.430469286314918875e-02, 9.102040816326530948e-01, 4.673808621060330792e-01], 
-[3.430469286314918875e-02, 9.122448979591837315e-01, 4.786803278322746547e-01], 
-[3.430469286314918875e-02, 9.142857142857142572e-01, 4.905057220053992140e-01], 
-[3.430469286314918875e-02, 9.163265306122448939e-01, 5.028948451379607887e-01], 
-[3.430469286314918875e-02, 9.183673469387755306e-01, 5.158892273753290514e-01], 
-[3.430469286314918875e-02, 9.204081632653061673e-01, 5.295346015068898016e-01], 
-[3.430469286314918875e-02, 9.224489795918368040e-01, 5.438814499860143981e-01], 
-[3.430469286314918875e-02, 9.244897959183673297e-01, 5.589856398503467716e-01], 
-[3.430469286314918875e-02, 9.265306122448979664e-01, 5.749091624994058236e-01], 
-[3.430469286314918875e-02, 9.285714285714286031e-01, 5.917209991352607723e-01], 
-[3.430469286314918875e-02, 9.306122448979592399e-01, 6.094981375333424767e-01], 
-[3.430469286314918875e-02, 9.326530612244897656e-01, 6.283267719888798730e-01], 
-[3.430469286314918875e-02, 9.346938775510204023e-01, 6.483037261897868220e-01], 
-[3.430469286314918875e-02, 9.367346938775510390e-01, 6.695381489525868979e-01], 
-[3.430469286314918875e-02, 9.387755102040816757e-01, 6.921535459799166290e-01], 
-[3.430469286314918875e-02, 9.408163265306123124e-01, 7.162902280971045199e-01], 
-[3.430469286314918875e-02, 9.428571428571428381e-01, 7.421082792489804847e-01], 
-[3.430469286314918875e-02, 9.448979591836734748e-01, 7.697911779202787352e-01], 
-[3.430469286314918875e-02, 9.469387755102041115e-01, 7.995502464738677428e-01], 
-[3.430469286314918875e-02, 9.489795918367347483e-01, 8.316301583348708615e-01], 
-[3.430469286314918875e-02, 9.510204081632652739e-01, 8.663158090338018980e-01], 
-[3.430469286314918875e-02, 9.530612244897959107e-01, 9.039409627826137106e-01], 
-[3.430469286314918875e-02, 9.551020408163265474e-01, 9.448992348553977294e-01], 
-[3.430469286314918875e-02, 9.571428571428571841e-01, 9.896581819019332205e-01], 
-[3.430469286314918875e-02, 9.591836734693878208e-01, 1.038777578870330176e+00], 
-[3.430469286314918875e-02, 9.612244897959183465e-01, 1.092933411982113467e+00], 
-[3.430469286314918875e-02, 9.632653061224489832e-01, 1.152949791805678803e+00], 
-[3.430469286314918875e-02, 9.653061224489796199e-01, 1.219842019741492312e+00], 
-[3.430469286314918875e-02, 9.673469387755102566e-01, 1.294875645402297604e+00], 
-[3.430469286314918875e-02, 9.693877551020407823e-01, 1.379648912207509515e+00], 
-[3.430469286314918875e-02, 9.714285714285714191e-01, 1.476210182107309254e+00], 
-[3.430469286314918875e-02, 9.734693877551020558e-01, 1.587229005976107388e+00], 
-[3.430469286314918875e-02, 9.755102040816326925e-01, 1.716251849055879131e+00], 
-[3.430469286314918875e-02, 9.775510204081632182e-01, 1.868095845654969667e+00], 
-[3.430469286314918875e-02, 9.795918367346938549e-01, 2.049476293961808082e+00], 
-[3.430469286314918875e-02, 9.816326530612244916e-01, 2.270047936773909036e+00], 
-[3.430469286314918875e-02, 9.836734693877551283e-01, 2.544218502201496257e+00], 
-[3.430469286314918875e-02, 9.857142857142857650e-01, 2.894498843432548263e+00], 
-[3.430469286314918875e-02, 9.877551020408162907e-01, 3.358163185242404314e+00], 
-[3.430469286314918875e-02, 9.897959183673469274e-01, 4.001801202508866950e+00], 
-[3.430469286314918875e-02, 9.918367346938775642e-01, 4.957404359315892073e+00], 
-[3.430469286314918875e-02, 9.938775510204082009e-01, 6.529552205620743344e+00], 
-[3.430469286314918875e-02, 9.959183673469387266e-01, 9.618557403789788296e+00], 
-[3.430469286314918875e-02, 9.979591836734693633e-01, 1.862205191921558622e+01], 
-[3.430469286314918875e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[3.764935806792469447e-02, 1.000000000000000021e-03, 2.757963034376266151e-02], 
-[3.764935806792469447e-02, 1.148922311909569708e-03, 2.755963641081489099e-02], 
-[3.764935806792469447e-02, 1.320022478803632065e-03, 2.754021944527975177e-02], 
-[3.764935806792469447e-02, 1.516603278119670137e-03, 2.752146574316069461e-02], 
-[3.764935806792469447e-02, 1.742459344546885402e-03, 2.750347466409780450e-02], 
-[3.764935806792469447e-02, 2.001950418545241171e-03, 2.748636065877996248e-02], 
-[3.764935806792469447e-02, 2.300085503203331758e-03, 2.747025562636765811e-02], 
-[3.764935806792469447e-02, 2.642619553930058204e-03, 2.745531166093069519e-02], 
-[3.764935806792469447e-02, 3.036164567398761706e-03, 2.744170425718670675e-02], 
-[3.764935806792469447e-02, 3.488317214113704091e-03, 2.742963606071787894e-02], 
-[3.764935806792469447e-02, 4.007805478313466660e-03, 2.741934126601656627e-02], 
-[3.764935806792469447e-02, 4.604657135827751671e-03, 2.741109078846950403e-02], 
-[3.764935806792469447e-02, 5.290393322046124149e-03, 2.740519836516680519e-02], 
-[3.764935806792469447e-02, 6.078250926476181683e-03, 2.740202777553137070e-02], 
-[3.764935806792469447e-02, 6.983438106813499684e-03, 2.740200141922629826e-02], 
-[3.764935806792469447e-02, 8.023427854757562983e-03, 2.740561054790635956e-02], 
-[3.764935806792469447e-02, 9.218295280327699903e-03, 2.741342752388607057e-02], 
-[3.764935806792469447e-02, 1.059110512533918171e-02, 2.742612057800445854e-02], 
-[3.764935806792469447e-02, 1.216835698628199354e-02, 2.744447166859894510e-02], 
-[3.764935806792469447e-02, 1.398049684082008047e-02, 2.746939821397111070e-02], 
-[3.764935806792469447e-02, 1.606250475199945058e-02, 2.750197969654250008e-02], 
-[3.764935806792469447e-02, 1.845457009472566828e-02, 2.754349043790538243e-02], 
-[3.764935806792469447e-02, 2.120286733852943389e-02, 2.759544024867462142e-02], 
-[3.764935806792469447e-02, 2.436044736169515681e-02, 2.765962520493384438e-02], 
-[3.764935806792469447e-02, 2.798826150195019707e-02, 2.773819155149198634e-02], 
-[3.764935806792469447e-02, 3.215633811115024138e-02, 2.783371676355205979e-02], 
-[3.764935806792469447e-02, 3.694513432520856594e-02, 2.794931323369354015e-02], 
-[3.764935806792469447e-02, 4.244708914272822542e-02, 2.808876206967300670e-02], 
-[3.764935806792469447e-02, 4.876840779169493850e-02, 2.825668736044201559e-02], 
-[3.764935806792469447e-02, 5.603111182818285713e-02, 2.845878540566162962e-02], 
-[3.764935806792469447e-02, 6.437539454049952259e-02, 2.870212944946005582e-02], 
-[3.764935806792469447e-02, 7.396232712556144451e-02, 2.899557942836942376e-02], 
-[3.764935806792469447e-02, 8.497696787531199003e-02, 2.935033977863408389e-02], 
-[3.764935806792469447e-02, 9.763193439036874088e-02, 2.978072916356440045e-02], 
-[3.764935806792469447e-02, 1.121715077759858903e-01, 3.030525867499778842e-02], 
-[3.764935806792469447e-02, 1.288763480443681220e-01, 3.094816763695829032e-02], 
-[3.764935806792469447e-02, 1.480689117455977755e-01, 3.174165295427174016e-02], 
-[3.764935806792469447e-02, 1.701196764046864207e-01, 3.272917566268532946e-02], 
-[3.764935806792469447e-02, 1.954542919161802172e-01, 3.397048837777378455e-02], 
-[3.764935806792469447e-02, 2.245617969409859638e-01, 3.554950335169461406e-02], 
-[3.764935806792469447e-02, 2.580040589080049296e-01, 3.758703246945865883e-02], 
-[3.764935806792469447e-02, 2.964266198426381838e-01, 4.026227121235012585e-02], 
-[3.764935806792469447e-02, 3.405711573811430193e-01, 4.385085615620728378e-02], 
-[3.764935806792469447e-02, 3.912898015080607528e-01, 4.879650557341513872e-02], 
-[3.764935806792469447e-02, 4.495615833752782953e-01, 5.585664350493733249e-02], 
-[3.764935806792469447e-02, 5.165113337172515529e-01, 6.642958878921471910e-02], 
-[3.764935806792469447e-02, 5.934313956619206021e-01, 8.339715580157941455e-02], 
-[3.764935806792469447e-02, 6.818065710636164178e-01, 1.137716890028233896e-01], 
-[3.764935806792469447e-02, 7.833427819015473803e-01, 1.802042857938876419e-01], 
-[3.764935806792469447e-02, 9.000000000000000222e-01, 4.209612539081444282e-01], 
-[3.764935806792469447e-02, 9.020408163265306589e-01, 4.301618556543999050e-01], 
-[3.764935806792469447e-02, 9.040816326530612956e-01, 4.397454209315437845e-01], 
-[3.764935806792469447e-02, 9.061224489795918213e-01, 4.497364793902332014e-01], 
-[3.764935806792469447e-02, 9.081632653061224580e-01, 4.601617118544583662e-01], 
-[3.764935806792469447e-02, 9.102040816326530948e-01, 4.710501921326830654e-01], 
-[3.764935806792469447e-02, 9.122448979591837315e-01, 4.824336622636292704e-01], 
-[3.764935806792469447e-02, 9.142857142857142572e-01, 4.943468467253411269e-01], 
-[3.764935806792469447e-02, 9.163265306122448939e-01, 5.068278122073484049e-01], 
-[3.764935806792469447e-02, 9.183673469387755306e-01, 5.199183808566236742e-01], 
-[3.764935806792469447e-02, 9.204081632653061673e-01, 5.336646065192907074e-01], 
-[3.764935806792469447e-02, 9.224489795918368040e-01, 5.481173254906768211e-01], 
-[3.764935806792469447e-02, 9.244897959183673297e-01, 5.633327957580716028e-01], 
-[3.764935806792469447e-02, 9.265306122448979664e-01, 5.793734418062974623e-01], 
-[3.764935806792469447e-02, 9.285714285714286031e-01, 5.963087259304007404e-01], 
-[3.764935806792469447e-02, 9.306122448979592399e-01, 6.142161718931394843e-01], 
-[3.764935806792469447e-02, 9.326530612244897656e-01, 6.331825729840775407e-01], 
-[3.764935806792469447e-02, 9.346938775510204023e-01, 6.533054244943807820e-01], 
-[3.764935806792469447e-02, 9.367346938775510390e-01, 6.746946308740262577e-01], 
-[3.764935806792469447e-02, 9.387755102040816757e-01, 6.974745511466569070e-01], 
-[3.764935806792469447e-02, 9.408163265306123124e-01, 7.217864635693429509e-01], 
-[3.764935806792469447e-02, 9.428571428571428381e-01, 7.477915534970063227e-01], 
-[3.764935806792469447e-02, 9.448979591836734748e-01, 7.756745589912065197e-01], 
-[3.764935806792469447e-02, 9.469387755102041115e-01, 8.056482498089727606e-01], 
-[3.764935806792469447e-02, 9.489795918367347483e-01, 8.379589712003171487e-01], 
-[3.764935806792469447e-02, 9.510204081632652739e-01, 8.728935605198292480e-01], 
-[3.764935806792469447e-02, 9.530612244897959107e-01, 9.107880509996725271e-01], 
-[3.764935806792469447e-02, 9.551020408163265474e-01, 9.520387265845910996e-01], 
-[3.764935806792469447e-02, 9.571428571428571841e-01, 9.971163049444505821e-01], 
-[3.764935806792469447e-02, 9.591836734693878208e-01, 1.046584334287992801e+00], 
-[3.764935806792469447e-02, 9.612244897959183465e-01, 1.101123343242224495e+00], 
-[3.764935806792469447e-02, 9.632653061224489832e-01, 1.161562961951618789e+00], 
-[3.764935806792469447e-02, 9.653061224489796199e-01, 1.228925268338434185e+00], 
-[3.764935806792469447e-02, 9.673469387755102566e-01, 1.304484227761310455e+00], 
-[3.764935806792469447e-02, 9.693877551020407823e-01, 1.389848670244465456e+00], 
-[3.764935806792469447e-02, 9.714285714285714191e-01, 1.487080469317606957e+00], 
-[3.764935806792469447e-02, 9.734693877551020558e-01, 1.598866706273234906e+00], 
-[3.764935806792469447e-02, 9.755102040816326925e-01, 1.728777023149231873e+00], 
-[3.764935806792469447e-02, 9.775510204081632182e-01, 1.881659870811361213e+00], 
-[3.764935806792469447e-02, 9.795918367346938549e-01, 2.064273955499747792e+00], 
-[3.764935806792469447e-02, 9.816326530612244916e-01, 2.286336037804467036e+00], 
-[3.764935806792469447e-02, 9.836734693877551283e-01, 2.562345750497401653e+00], 
-[3.764935806792469447e-02, 9.857142857142857650e-01, 2.914956415816648772e+00], 
-[3.764935806792469447e-02, 9.877551020408162907e-01, 3.381676053562871154e+00], 
-[3.764935806792469447e-02, 9.897959183673469274e-01, 4.029507651570946258e+00], 
-[3.764935806792469447e-02, 9.918367346938775642e-01, 4.991251665007390592e+00], 
-[3.764935806792469447e-02, 9.938775510204082009e-01, 6.573325111620409444e+00], 
-[3.764935806792469447e-02, 9.959183673469387266e-01, 9.681356511677785548e+00], 
-[3.764935806792469447e-02, 9.979591836734693633e-01, 1.873805388940377981e+01], 
-[3.764935806792469447e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[4.132012400115338963e-02, 1.000000000000000021e-03, 2.783574917062490994e-02], 
-[4.132012400115338963e-02, 1.148922311909569708e-03, 2.781536390158614869e-02], 
-[4.132012400115338963e-02, 1.320022478803632065e-03, 2.779556061227752076e-02], 
-[4.132012400115338963e-02, 1.516603278119670137e-03, 2.777642634397155252e-02], 
-[4.132012400115338963e-02, 1.742459344546885402e-03, 2.775806131375831848e-02], 
-[4.132012400115338963e-02, 2.001950418545241171e-03, 2.774058095926557055e-02], 
-[4.132012400115338963e-02, 2.300085503203331758e-03, 2.772411831621501149e-02], 
-[4.132012400115338963e-02, 2.642619553930058204e-03, 2.770882678828849588e-02], 
-[4.132012400115338963e-02, 3.036164567398761706e-03, 2.769488338020125590e-02], 
-[4.132012400115338963e-02, 3.488317214113704091e-03, 2.768249247987781755e-02], 
-[4.132012400115338963e-02, 4.007805478313466660e-03, 2.767189029395632563e-02], 
-[4.132012400115338963e-02, 4.604657135827751671e-03, 2.766335006380120365e-02], 
-[4.132012400115338963e-02, 5.290393322046124149e-03, 2.765718821821460532e-02], 
-[4.132012400115338963e-02, 6.078250926476181683e-03, 2.765377165546794788e-02], 
-[4.132012400115338963e-02, 6.983438106813499684e-03, 2.765352639410957603e-02], 
-[4.132012400115338963e-02, 8.023427854757562983e-03, 2.765694789162480988e-02], 
-[4.132012400115338963e-02, 9.218295280327699903e-03, 2.766461340716894896e-02], 
-[4.132012400115338963e-02, 1.059110512533918171e-02, 2.767719688463732286e-02], 
-[4.132012400115338963e-02, 1.216835698628199354e-02, 2.769548696305647664e-02], 
-[4.132012400115338963e-02, 1.398049684082008047e-02, 2.772040889318203374e-02], 
-[4.132012400115338963e-02, 1.606250475199945058e-02, 2.775305136689053959e-02], 
-[4.132012400115338963e-02, 1.845457009472566828e-02, 2.779469956948362602e-02], 
-[4.132012400115338963e-02, 2.120286733852943389e-02, 2.784687617309247742e-02], 
-[4.132012400115338963e-02, 2.436044736169515681e-02, 2.791139254182790908e-02], 
-[4.132012400115338963e-02, 2.798826150195019707e-02, 2.799041317396411266e-02], 
-[4.132012400115338963e-02, 3.215633811115024138e-02, 2.808653744638827526e-02], 
-[4.132012400115338963e-02, 3.694513432520856594e-02, 2.820290417373111716e-02], 
-[4.132012400115338963e-02, 4.244708914272822542e-02, 2.834332652987173878e-02], 
-[4.132012400115338963e-02, 4.876840779169493850e-02, 2.851246777507301933e-02], 
-[4.132012400115338963e-02, 5.603111182818285713e-02, 2.871607240389984633e-02], 
-[4.132012400115338963e-02, 6.437539454049952259e-02, 2.896127342410999284e-02], 
-[4.132012400115338963e-02, 7.396232712556144451e-02, 2.925700551923911610e-02], 
-[4.132012400115338963e-02, 8.497696787531199003e-02, 2.961456749322102094e-02], 
-[4.132012400115338963e-02, 9.763193439036874088e-02, 3.004839838009036590e-02], 
-[4.132012400115338963e-02, 1.121715077759858903e-01, 3.057716456015226181e-02], 
-[4.132012400115338963e-02, 1.288763480443681220e-01, 3.122530822270636053e-02], 
-[4.132012400115338963e-02, 1.480689117455977755e-01, 3.202529502891101471e-02], 
-[4.132012400115338963e-02, 1.701196764046864207e-01, 3.302094772687959312e-02], 
-[4.132012400115338963e-02, 1.954542919161802172e-01, 3.427251458938966600e-02], 
-[4.132012400115338963e-02, 2.245617969409859638e-01, 3.586460134372444764e-02], 
-[4.132012400115338963e-02, 2.580040589080049296e-01, 3.791901410699486524e-02], 
-[4.132012400115338963e-02, 2.964266198426381838e-01, 4.061641604734296529e-02], 
-[4.132012400115338963e-02, 3.405711573811430193e-01, 4.423468906813440849e-02], 
-[4.132012400115338963e-02, 3.912898015080607528e-01, 4.922114339232472324e-02], 
-[4.132012400115338963e-02, 4.495615833752782953e-01, 5.633928992787178014e-02], 
-[4.132012400115338963e-02, 5.165113337172515529e-01, 6.699858800705120465e-02], 
-[4.132012400115338963e-02, 5.934313956619206021e-01, 8.410357100459228685e-02], 
-[4.132012400115338963e-02, 6.818065710636164178e-01, 1.147211291994051086e-01], 
-[4.132012400115338963e-02, 7.833427819015473803e-01, 1.816753061517132617e-01], 
-[4.132012400115338963e-02, 9.000000000000000222e-01, 4.242544396581963140e-01], 
-[4.132012400115338963e-02, 9.020408163265306589e-01, 4.335232130612809986e-01], 
-[4.132012400115338963e-02, 9.040816326530612956e-01, 4.431776972379231072e-01], 
-[4.132012400115338963e-02, 9.061224489795918213e-01, 4.532425939592435449e-01], 
-[4.132012400115338963e-02, 9.081632653061224580e-01, 4.637447710122276079e-01], 
-[4.132012400115338963e-02, 9.102040816326530948e-01, 4.747135056565602862e-01], 
-[4.132012400115338963e-02, 9.122448979591837315e-01, 4.861807617410123239e-01], 
-[4.132012400115338963e-02, 9.142857142857142572e-01, 4.981815060448265831e-01], 
-[4.132012400115338963e-02, 9.163265306122448939e-01, 5.107540704878038573e-01], 
-[4.132012400115338963e-02, 9.183673469387755306e-01, 5.239405681723008357e-01], 
-[4.132012400115338963e-02, 9.204081632653061673e-01, 5.377873728422135624e-01], 
-[4.132012400115338963e-02, 9.224489795918368040e-01, 5.523456733477284386e-01], 
-[4.132012400115338963e-02, 9.244897959183673297e-01, 5.676721171926026877e-01], 
-[4.132012400115338963e-02, 9.265306122448979664e-01, 5.838295603466779893e-01], 
-[4.132012400115338963e-02, 9.285714285714286031e-01, 6.008879444058521369e-01], 
-[4.132012400115338963e-02, 9.306122448979592399e-01, 6.189253271070243034e-01], 
-[4.132012400115338963e-02, 9.326530612244897656e-01, 6.380290984651626474e-01], 
-[4.132012400115338963e-02, 9.346938775510204023e-01, 6.582974228086488910e-01], 
-[4.132012400115338963e-02, 9.367346938775510390e-01, 6.798409573081785062e-01], 
-[4.132012400115338963e-02, 9.387755102040816757e-01, 7.027849109891908252e-01], 
-[4.132012400115338963e-02, 9.408163265306123124e-01, 7.272715257423322255e-01], 
-[4.132012400115338963e-02, 9.428571428571428381e-01, 7.534630839670688474e-01], 
-[4.132012400115338963e-02, 9.448979591836734748e-01, 7.815455782602548362e-01], 
-[4.132012400115338963e-02, 9.469387755102041115e-01, 8.117332199212496935e-01], 
-[4.132012400115338963e-02, 9.489795918367347483e-01, 8.442740191954231088e-01], 
-[4.132012400115338963e-02, 9.510204081632652739e-01, 8.794567472438813427e-01], 
-[4.132012400115338963e-02, 9.530612244897959107e-01, 9.176196968468109949e-01], 
-[4.132012400115338963e-02, 9.551020408163265474e-01, 9.591618093516256494e-01], 
-[4.132012400115338963e-02, 9.571428571428571841e-01, 1.004556949943421706e+00], 
-[4.132012400115338963e-02, 9.591836734693878208e-01, 1.054372423773133116e+00], 
-[4.132012400115338963e-02, 9.612244897959183465e-01, 1.109293281977895340e+00], 
-[4.132012400115338963e-02, 9.632653061224489832e-01, 1.170154649782019884e+00], 
-[4.132012400115338963e-02, 9.653061224489796199e-01, 1.237985351138269685e+00], 
-[4.132012400115338963e-02, 9.673469387755102566e-01, 1.314067728735357043e+00], 
-[4.132012400115338963e-02, 9.693877551020407823e-01, 1.400021150142306547e+00], 
-[4.132012400115338963e-02, 9.714285714285714191e-01, 1.497920936851560025e+00], 
-[4.132012400115338963e-02, 9.734693877551020558e-01, 1.610471616639518988e+00], 
-[4.132012400115338963e-02, 9.755102040816326925e-01, 1.741265895380939455e+00], 
-[4.132012400115338963e-02, 9.775510204081632182e-01, 1.895183384949214789e+00], 
-[4.132012400115338963e-02, 9.795918367346938549e-01, 2.079025979604988361e+00], 
-[4.132012400115338963e-02, 9.816326530612244916e-01, 2.302572136403920666e+00], 
-[4.132012400115338963e-02, 9.836734693877551283e-01, 2.580412905110183619e+00], 
-[4.132012400115338963e-02, 9.857142857142857650e-01, 2.935343300947006462e+00], 
-[4.132012400115338963e-02, 9.877551020408162907e-01, 3.405103827425924656e+00], 
-[4.132012400115338963e-02, 9.897959183673469274e-01, 4.057108388970133817e+00], 
-[4.132012400115338963e-02, 9.918367346938775642e-01, 5.024961556791857298e+00], 
-[4.132012400115338963e-02, 9.938775510204082009e-01, 6.616906214677557685e+00], 
-[4.132012400115338963e-02, 9.959183673469387266e-01, 9.743851086209849299e+00], 
-[4.132012400115338963e-02, 9.979591836734693633e-01, 1.885339593163029548e+01], 
-[4.132012400115338963e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[4.534878508128584174e-02, 1.000000000000000021e-03, 2.809222125795148017e-02], 
-[4.534878508128584174e-02, 1.148922311909569708e-03, 2.807144064932619656e-02], 
-[4.534878508128584174e-02, 1.320022478803632065e-03, 2.805124703373695905e-02], 
-[4.534878508128584174e-02, 1.516603278119670137e-03, 2.803172819780068090e-02], 
-[4.534878508128584174e-02, 1.742459344546885402e-03, 2.801298521613307391e-02], 
-[4.534878508128584174e-02, 2.001950418545241171e-03, 2.799513451337623179e-02], 
-[4.534878508128584174e-02, 2.300085503203331758e-03, 2.797831026188597053e-02], 
-[4.534878508128584174e-02, 2.642619553930058204e-03, 2.796266717502429722e-02], 
-[4.534878508128584174e-02, 3.036164567398761706e-03, 2.794838376756444281e-02], 
-[4.534878508128584174e-02, 3.488317214113704091e-03, 2.793566616982209871e-02], 
-[4.534878508128584174e-02, 4.007805478313466660e-03, 2.792475260061373643e-02], 
-[4.534878508128584174e-02, 4.604657135827751671e-03, 2.791591862729159157e-02], 
-[4.534878508128584174e-02, 5.290393322046124149e-03, 2.790948337035011745e-02], 
-[4.534878508128584174e-02, 6.078250926476181683e-03, 2.790581684684999286e-02], 
-[4.534878508128584174e-02, 6.983438106813499684e-03, 2.790534869411427296e-02], 
-[4.534878508128584174e-02, 8.023427854757562983e-03, 2.790857857528179081e-02], 
-[4.534878508128584174e-02, 9.218295280327699903e-03, 2.791608864608621787e-02], 
-[4.534878508128584174e-02, 1.059110512533918171e-02, 2.792855856311185839e-02], 
-[4.534878508128584174e-02, 1.216835698628199354e-02, 2.794678364554827737e-02], 
-[4.534878508128584174e-02, 1.398049684082008047e-02, 2.797169697592701704e-02], 
-[4.534878508128584174e-02, 1.606250475199945058e-02, 2.800439645465203908e-02], 
-[4.534878508128584174e-02, 1.845457009472566828e-02, 2.804617812951371372e-02], 
-[4.534878508128584174e-02, 2.120286733852943389e-02, 2.809857753255339680e-02], 
-[4.534878508128584174e-02, 2.436044736169515681e-02, 2.816342131380050046e-02], 
-[4.534878508128584174e-02, 2.798826150195019707e-02, 2.824289222222653439e-02], 
-[4.534878508128584174e-02, 3.215633811115024138e-02, 2.833961153276261941e-02], 
-[4.534878508128584174e-02, 3.694513432520856594e-02, 2.845674447728610557e-02], 
-[4.534878508128584174e-02, 4.244708914272822542e-02, 2.859813628942483449e-02], 
-[4.534878508128584174e-02, 4.876840779169493850e-02, 2.876848939224246546e-02], 
-[4.534878508128584174e-02, 5.603111182818285713e-02, 2.897359646375627373e-02], 
-[4.534878508128584174e-02, 6.437539454049952259e-02, 2.922065025980773861e-02], 
-[4.534878508128584174e-02, 7.396232712556144451e-02, 2.951866018962136587e-02], 
-[4.534878508128584174e-02, 8.497696787531199003e-02, 2.987901939527526363e-02], 
-[4.534878508128584174e-02, 9.763193439036874088e-02, 3.031628724008241654e-02], 
-[4.534878508128584174e-02, 1.121715077759858903e-01, 3.084928533391389713e-02], 
-[4.534878508128584174e-02, 1.288763480443681220e-01, 3.150265864643787828e-02], 
-[4.534878508128584174e-02, 1.480689117455977755e-01, 3.230914147082392107e-02], 
-[4.534878508128584174e-02, 1.701196764046864207e-01, 3.331291808232974411e-02], 
-[4.534878508128584174e-02, 1.954542919161802172e-01, 3.457473212952080766e-02], 
-[4.534878508128584174e-02, 2.245617969409859638e-01, 3.617988237752282205e-02], 
-[4.534878508128584174e-02, 2.580040589080049296e-01, 3.825116847797591091e-02], 
-[4.534878508128584174e-02, 2.964266198426381838e-01, 4.097072013763577991e-02], 
-[4.534878508128584174e-02, 3.405711573811430193e-01, 4.461866262351590895e-02], 
-[4.534878508128584174e-02, 3.912898015080607528e-01, 4.964589458509393455e-02], 
-[4.534878508128584174e-02, 4.495615833752782953e-01, 5.682200706925401301e-02], 
-[4.534878508128584174e-02, 5.165113337172515529e-01, 6.756758594384684735e-02], 
-[4.534878508128584174e-02, 5.934313956619206021e-01, 8.480985102720184354e-02], 
-[4.534878508128584174e-02, 6.818065710636164178e-01, 1.156701477315071891e-01], 
-[4.534878508128584174e-02, 7.833427819015473803e-01, 1.831451231302838600e-01], 
-[4.534878508128584174e-02, 9.000000000000000222e-01, 4.275425520798900036e-01], 
-[4.534878508128584174e-02, 9.020408163265306589e-01, 4.368793274407272165e-01], 
-[4.534878508128584174e-02, 9.040816326530612956e-01, 4.466045524281317403e-01], 
-[4.534878508128584174e-02, 9.061224489795918213e-01, 4.567431003416286828e-01], 
-[4.534878508128584174e-02, 9.081632653061224580e-01, 4.673220252837170241e-01], 
-[4.534878508128584174e-02, 9.102040816326530948e-01, 4.783708072558592872e-01], 
-[4.534878508128584174e-02, 9.122448979591837315e-01, 4.899216311379890332e-01], 
-[4.534878508128584174e-02, 9.142857142857142572e-01, 5.020097051536378530e-01], 
-[4.534878508128584174e-02, 9.163265306122448939e-01, 5.146736255080716083e-01], 
-[4.534878508128584174e-02, 9.183673469387755306e-01, 5.279557952149314115e-01], 
-[4.534878508128584174e-02, 9.204081632653061673e-01, 5.419029067592888715e-01], 
-[4.534878508128584174e-02, 9.224489795918368040e-01, 5.565665002617504742e-01], 
-[4.534878508128584174e-02, 9.244897959183673297e-01, 5.720036113123529997e-01], 
-[4.534878508128584174e-02, 9.265306122448979664e-01, 5.882775257690453508e-01], 
-[4.534878508128584174e-02, 9.285714285714286031e-01, 6.054586627402656074e-01], 
-[4.534878508128584174e-02, 9.306122448979592399e-01, 6.236256119281998744e-01], 
-[4.534878508128584174e-02, 9.326530612244897656e-01, 6.428663578092248532e-01], 
-[4.534878508128584174e-02, 9.346938775510204023e-01, 6.632797311885414437e-01], 
-[4.534878508128584174e-02, 9.367346938775510390e-01, 6.849771390513030855e-01], 
-[4.534878508128584174e-02, 9.387755102040816757e-01, 7.080846371129962957e-01], 
-[4.534878508128584174e-02, 9.408163265306123124e-01, 7.327454271083125859e-01], 
-[4.534878508128584174e-02, 9.428571428571428381e-01, 7.591228841257561255e-01], 
-[4.534878508128584174e-02, 9.448979591836734748e-01, 7.874042502676827926e-01], 
-[4.534878508128584174e-02, 9.469387755102041115e-01, 8.178051725377386560e-01], 
-[4.534878508128584174e-02, 9.489795918367347483e-01, 8.505753193634164600e-01], 
-[4.534878508128584174e-02, 9.510204081632652739e-01, 8.860053877141514933e-01], 
-[4.534878508128584174e-02, 9.530612244897959107e-01, 9.244359204691643406e-01], 
-[4.534878508128584174e-02, 9.551020408163265474e-01, 9.662685051385093704e-01], 
-[4.534878508128584174e-02, 9.571428571428571841e-01, 1.011980140951638241e+00], 
-[4.534878508128584174e-02, 9.591836734693878208e-01, 1.062141873724880226e+00], 
-[4.534878508128584174e-02, 9.612244897959183465e-01, 1.117443257261676148e+00], 
-[4.534878508128584174e-02, 9.632653061224489832e-01, 1.178724887434334789e+00], 
-[4.534878508128584174e-02, 9.653061224489796199e-01, 1.247022303816279765e+00], 
-[4.534878508128584174e-02, 9.673469387755102566e-01, 1.323626188114760849e+00], 
-[4.534878508128584174e-02, 9.693877551020407823e-01, 1.410166396519083154e+00], 
-[4.534878508128584174e-02, 9.714285714285714191e-01, 1.508731635046417718e+00], 
-[4.534878508128584174e-02, 9.734693877551020558e-01, 1.622043794263202665e+00], 
-[4.534878508128584174e-02, 9.755102040816326925e-01, 1.753718531251815316e+00], 
-[4.534878508128584174e-02, 9.775510204081632182e-01, 1.908666463807078717e+00], 
-[4.534878508128584174e-02, 9.795918367346938549e-01, 2.093732454849225988e+00], 
-[4.534878508128584174e-02, 9.816326530612244916e-01, 2.318756337574496840e+00], 
-[4.534878508128584174e-02, 9.836734693877551283e-01, 2.598420092629405431e+00], 
-[4.534878508128584174e-02, 9.857142857142857650e-01, 2.955659654707829986e+00], 
-[4.534878508128584174e-02, 9.877551020408162907e-01, 3.428446704159187064e+00], 
-[4.534878508128584174e-02, 9.897959183673469274e-01, 4.084603674021400010e+00], 
-[4.534878508128584174e-02, 9.918367346938775642e-01, 5.058534394268034085e+00], 
-[4.534878508128584174e-02, 9.938775510204082009e-01, 6.660296057208428877e+00], 
-[4.534878508128584174e-02, 9.959183673469387266e-01, 9.806042079275034240e+00], 
-[4.534878508128584174e-02, 9.979591836734693633e-01, 1.896808044604841115e+01], 
-[4.534878508128584174e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[4.977023564332111460e-02, 1.000000000000000021e-03, 2.834904685063015933e-02], 
-[4.977023564332111460e-02, 1.148922311909569708e-03, 2.832786689207426878e-02], 
-[4.977023564332111460e-02, 1.320022478803632065e-03, 2.830727894084027890e-02], 
-[4.977023564332111460e-02, 1.516603278119670137e-03, 2.828737152896343421e-02], 
-[4.977023564332111460e-02, 1.742459344546885402e-03, 2.826824658865943404e-02], 
-[4.977023564332111460e-02, 2.001950418545241171e-03, 2.825002153165860966e-02], 
-[4.977023564332111460e-02, 2.300085503203331758e-03, 2.823283166702190983e-02], 
-[4.977023564332111460e-02, 2.642619553930058204e-03, 2.821683301785751774e-02], 
-[4.977023564332111460e-02, 3.036164567398761706e-03, 2.820220560905465496e-02], 
-[4.977023564332111460e-02, 3.488317214113704091e-03, 2.818915731337683431e-02], 
-[4.977023564332111460e-02, 4.007805478313466660e-03, 2.817792836181647748e-02], 
-[4.977023564332111460e-02, 4.604657135827751671e-03, 2.816879664775183076e-02], 
-[4.977023564332111460e-02, 5.290393322046124149e-03, 2.816208398333512955e-02], 
-[4.977023564332111460e-02, 6.078250926476181683e-03, 2.815816350435230986e-02], 
-[4.977023564332111460e-02, 6.983438106813499684e-03, 2.815746846678494203e-02], 
-[4.977023564332111460e-02, 8.023427854757562983e-03, 2.816050273924190078e-02], 
-[4.977023564332111460e-02, 9.218295280327699903e-03, 2.816785337376538287e-02], 
-[4.977023564332111460e-02, 1.059110512533918171e-02, 2.818020573924307284e-02], 
-[4.977023564332111460e-02, 1.216835698628199354e-02, 2.819836183452026010e-02], 
-[4.977023564332111460e-02, 1.398049684082008047e-02, 2.822326257318563680e-02], 
-[4.977023564332111460e-02, 1.606250475199945058e-02, 2.825601506323901016e-02], 
-[4.977023564332111460e-02, 1.845457009472566828e-02, 2.829792621372283212e-02], 
-[4.977023564332111460e-02, 2.120286733852943389e-02, 2.835054441496361738e-02], 
-[4.977023564332111460e-02, 2.436044736169515681e-02, 2.841571160077856900e-02], 
-[4.977023564332111460e-02, 2.798826150195019707e-02, 2.849562876804229150e-02], 
-[4.977023564332111460e-02, 3.215633811115024138e-02, 2.859293908605834572e-02], 
-[4.977023564332111460e-02, 3.694513432520856594e-02, 2.871083419910876872e-02], 
-[4.977023564332111460e-02, 4.244708914272822542e-02, 2.885319139415153111e-02], 
-[4.977023564332111460e-02, 4.876840779169493850e-02, 2.902475224848661411e-02], 
-[4.977023564332111460e-02, 5.603111182818285713e-02, 2.923135761206668154e-02], 
-[4.977023564332111460e-02, 6.437539454049952259e-02, 2.948025997319105029e-02], 
-[4.977023564332111460e-02, 7.396232712556144451e-02, 2.978054344536024828e-02], 
-[4.977023564332111460e-02, 8.497696787531199003e-02, 3.014369547913001851e-02], 
-[4.977023564332111460e-02, 9.763193439036874088e-02, 3.058439572549439406e-02], 
-[4.977023564332111460e-02, 1.121715077759858903e-01, 3.112162096479869147e-02], 
-[4.977023564332111460e-02, 1.288763480443681220e-01, 3.178021886193240636e-02], 
-[4.977023564332111460e-02, 1.480689117455977755e-01, 3.259319221744652606e-02], 
-[4.977023564332111460e-02, 1.701196764046864207e-01, 3.360508664812708601e-02], 
-[4.977023564332111460e-02, 1.954542919161802172e-01, 3.487714089639789433e-02], 
-[4.977023564332111460e-02, 2.245617969409859638e-01, 3.649534632727023664e-02], 
-[4.977023564332111460e-02, 2.580040589080049296e-01, 3.858349542845324748e-02], 
-[4.977023564332111460e-02, 2.964266198426381838e-01, 4.132518329589512929e-02], 
-[4.977023564332111460e-02, 3.405711573811430193e-01, 4.500277659482863207e-02], 
-[4.977023564332111460e-02, 3.912898015080607528e-01, 5.007075887522977053e-02], 
-[4.977023564332111460e-02, 4.495615833752782953e-01, 5.730479459257023511e-02], 
-[4.977023564332111460e-02, 5.165113337172515529e-01, 6.813658219047208364e-02], 
-[4.977023564332111460e-02, 5.934313956619206021e-01, 8.551599537922582872e-02], 
-[4.977023564332111460e-02, 6.818065710636164178e-01, 1.166187440551432336e-01], 
-[4.977023564332111460e-02, 7.833427819015473803e-01, 1.846137364060415620e-01], 
-[4.977023564332111460e-02, 9.000000000000000222e-01, 4.308255945360486838e-01], 
-[4.977023564332111460e-02, 9.020408163265306589e-01, 4.402302023690993771e-01], 
-[4.977023564332111460e-02, 9.040816326530612956e-01, 4.500259903058877464e-01], 
-[4.977023564332111460e-02, 9.061224489795918213e-01, 4.602380025834175159e-01], 
-[4.977023564332111460e-02, 9.081632653061224580e-01, 4.708934789734718906e-01], 
-[4.977023564332111460e-02, 9.102040816326530948e-01, 4.820221015112313157e-01], 
-[4.977023564332111460e-02, 9.122448979591837315e-01, 4.936562753304397089e-01], 
-[4.977023564332111460e-02, 9.142857142857142572e-01, 5.058314492437121501e-01], 
-[4.977023564332111460e-02, 9.163265306122448939e-01, 5.185864827988694303e-01], 
-[4.977023564332111460e-02, 9.183673469387755306e-01, 5.319640678788524202e-01], 
-[4.977023564332111460e-02, 9.204081632653061673e-01, 5.460112145556790253e-01], 
-[4.977023564332111460e-02, 9.224489795918368040e-01, 5.607798129385913599e-01], 
-[4.977023564332111460e-02, 9.244897959183673297e-01, 5.763272852767035159e-01], 
-[4.977023564332111460e-02, 9.265306122448979664e-01, 5.927173457225252129e-01], 
-[4.977023564332111460e-02, 9.285714285714286031e-01, 6.100208891125369348e-01], 
-[4.977023564332111460e-02, 9.306122448979592399e-01, 6.283170351096808437e-01], 
-[4.977023564332111460e-02, 9.326530612244897656e-01, 6.476943603926733628e-01], 
-[4.977023564332111460e-02, 9.346938775510204023e-01, 6.682523596887710582e-01], 
-[4.977023564332111460e-02, 9.367346938775510390e-01, 6.901031868977888228e-01], 
-[4.977023564332111460e-02, 9.387755102040816757e-01, 7.133737411209601920e-01], 
-[4.977023564332111460e-02, 9.408163265306123124e-01, 7.382081801561146683e-01], 
-[4.977023564332111460e-02, 9.428571428571428381e-01, 7.647709674353133646e-01], 
-[4.977023564332111460e-02, 9.448979591836734748e-01, 7.932505895483373815e-01], 
-[4.977023564332111460e-02, 9.469387755102041115e-01, 8.238641233788448481e-01], 
-[4.977023564332111460e-02, 9.489795918367347483e-01, 8.568628887394822424e-01], 
-[4.977023564332111460e-02, 9.510204081632652739e-01, 8.925395004291771794e-01], 
-[4.977023564332111460e-02, 9.530612244897959107e-01, 9.312367420003255791e-01], 
-[4.977023564332111460e-02, 9.551020408163265474e-01, 9.733588359135273427e-01], 
-[4.977023564332111460e-02, 9.571428571428571841e-01, 1.019385902005623734e+00], 
-[4.977023564332111460e-02, 9.591836734693878208e-01, 1.069892710523112633e+00], 
-[4.977023564332111460e-02, 9.612244897959183465e-01, 1.125573298143339951e+00], 
-[4.977023564332111460e-02, 9.632653061224489832e-01, 1.187273707019063540e+00], 
-[4.977023564332111460e-02, 9.653061224489796199e-01, 1.256036162015797375e+00], 
-[4.977023564332111460e-02, 9.673469387755102566e-01, 1.333159645651883274e+00], 
-[4.977023564332111460e-02, 9.693877551020407823e-01, 1.420284453947562753e+00], 
-[4.977023564332111460e-02, 9.714285714285714191e-01, 1.519512614185164479e+00], 
-[4.977023564332111460e-02, 9.734693877551020558e-01, 1.633583296267098417e+00], 
-[4.977023564332111460e-02, 9.755102040816326925e-01, 1.766134996183183814e+00], 
-[4.977023564332111460e-02, 9.775510204081632182e-01, 1.922109183025997314e+00], 
-[4.977023564332111460e-02, 9.795918367346938549e-01, 2.108393469683157662e+00], 
-[4.977023564332111460e-02, 9.816326530612244916e-01, 2.334888746166065232e+00], 
-[4.977023564332111460e-02, 9.836734693877551283e-01, 2.616367439449222232e+00], 
-[4.977023564332111460e-02, 9.857142857142857650e-01, 2.975905632726702610e+00], 
-[4.977023564332111460e-02, 9.877551020408162907e-01, 3.451704880742591186e+00], 
-[4.977023564332111460e-02, 9.897959183673469274e-01, 4.111993765548136892e+00], 
-[4.977023564332111460e-02, 9.918367346938775642e-01, 5.091970536295518102e+00], 
-[4.977023564332111460e-02, 9.938775510204082009e-01, 6.703495180405125708e+00], 
-[4.977023564332111460e-02, 9.959183673469387266e-01, 9.867930440350372479e+00], 
-[4.977023564332111460e-02, 9.979591836734693633e-01, 1.908210982562130198e+01], 
-[4.977023564332111460e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[5.462277217684342878e-02, 1.000000000000000021e-03, 2.860622619361965352e-02], 
-[5.462277217684342878e-02, 1.148922311909569708e-03, 2.858464286793646267e-02], 
-[5.462277217684342878e-02, 1.320022478803632065e-03, 2.856365656483238896e-02], 
-[5.462277217684342878e-02, 1.516603278119670137e-03, 2.854335656183380407e-02], 
-[5.462277217684342878e-02, 1.742459344546885402e-03, 2.852384564882934695e-02], 
-[5.462277217684342878e-02, 2.001950418545241171e-03, 2.850524222470984109e-02], 
-[5.462277217684342878e-02, 2.300085503203331758e-03, 2.848768273531057660e-02], 
-[5.462277217684342878e-02, 2.642619553930058204e-03, 2.847132451354986854e-02], 
-[5.462277217684342878e-02, 3.036164567398761706e-03, 2.845634909448845062e-02], 
-[5.462277217684342878e-02, 3.488317214113704091e-03, 2.844296609336967319e-02], 
-[5.462277217684342878e-02, 4.007805478313466660e-03, 2.843141775342220359e-02], 
-[5.462277217684342878e-02, 4.604657135827751671e-03, 2.842198429401898013e-02], 
-[5.462277217684342878e-02, 5.290393322046124149e-03, 2.841499021895329755e-02], 
-[5.462277217684342878e-02, 6.078250926476181683e-03, 2.841081178266745277e-02], 
-[5.462277217684342878e-02, 6.983438106813499684e-03, 2.840988585967980234e-02], 
-[5.462277217684342878e-02, 8.023427854757562983e-03, 2.841272052387937633e-02], 
-[5.462277217684342878e-02, 9.218295280327699903e-03, 2.841990772333951448e-02], 
-[5.462277217684342878e-02, 1.059110512533918171e-02, 2.843213853886212422e-02], 
-[5.462277217684342878e-02, 1.216835698628199354e-02, 2.845022164841577370e-02], 
-[5.462277217684342878e-02, 1.398049684082008047e-02, 2.847510579593097446e-02], 
-[5.462277217684342878e-02, 1.606250475199945058e-02, 2.850790729605299362e-02], 
-[5.462277217684342878e-02, 1.845457009472566828e-02, 2.854994391782374186e-02], 
-[5.462277217684342878e-02, 2.120286733852943389e-02, 2.860277690821103058e-02], 
-[5.462277217684342878e-02, 2.436044736169515681e-02, 2.866826348266688154e-02], 
-[5.462277217684342878e-02, 2.798826150195019707e-02, 2.874862288314848288e-02], 
-[5.462277217684342878e-02, 3.215633811115024138e-02, 2.884652016962906129e-02], 
-[5.462277217684342878e-02, 3.694513432520856594e-02, 2.896517339391610490e-02], 
-[5.462277217684342878e-02, 4.244708914272822542e-02, 2.910849188983441471e-02], 
-[5.462277217684342878e-02, 4.876840779169493850e-02, 2.928125638030179556e-02], 
-[5.462277217684342878e-02, 5.603111182818285713e-02, 2.948935587562381486e-02], 
-[5.462277217684342878e-02, 6.437539454049952259e-02, 2.974010258085191261e-02], 
-[5.462277217684342878e-02, 7.396232712556144451e-02, 3.004265529225167222e-02], 
-[5.462277217684342878e-02, 8.497696787531199003e-02, 3.040859573906844887e-02], 
-[5.462277217684342878e-02, 9.763193439036874088e-02, 3.085272381822884435e-02], 
-[5.462277217684342878e-02, 1.121715077759858903e-01, 3.139417142127127330e-02], 
-[5.462277217684342878e-02, 1.288763480443681220e-01, 3.205798882291708424e-02], 
-[5.462277217684342878e-02, 1.480689117455977755e-01, 3.287744720616603278e-02], 
-[5.462277217684342878e-02, 1.701196764046864207e-01, 3.389745334331836779e-02], 
-[5.462277217684342878e-02, 1.954542919161802172e-01, 3.517974078821421713e-02], 
-[5.462277217684342878e-02, 2.245617969409859638e-01, 3.681099306712102420e-02], 
-[5.462277217684342878e-02, 2.580040589080049296e-01, 3.891599480446937542e-02], 
-[5.462277217684342878e-02, 2.964266198426381838e-01, 4.167980533480436511e-02], 
-[5.462277217684342878e-02, 3.405711573811430193e-01, 4.538703075460526898e-02], 
-[5.462277217684342878e-02, 3.912898015080607528e-01, 5.049573598635346411e-02], 
-[5.462277217684342878e-02, 4.495615833752782953e-01, 5.778765216151246498e-02], 
-[5.462277217684342878e-02, 5.165113337172515529e-01, 6.870557633815965737e-02], 
-[5.462277217684342878e-02, 5.934313956619206021e-01, 8.622200357110740288e-02], 
-[5.462277217684342878e-02, 6.818065710636164178e-01, 1.175669176274394823e-01], 
-[5.462277217684342878e-02, 7.833427819015473803e-01, 1.860811456575209855e-01], 
-[5.462277217684342878e-02, 9.000000000000000222e-01, 4.341035703924125411e-01], 
-[5.462277217684342878e-02, 9.020408163265306589e-01, 4.435758414256051885e-01], 
-[5.462277217684342878e-02, 9.040816326530612956e-01, 4.534420146776740879e-01], 
-[5.462277217684342878e-02, 9.061224489795918213e-01, 4.637273047333090870e-01], 
-[5.462277217684342878e-02, 9.081632653061224580e-01, 4.744591363885987123e-01], 
-[5.462277217684342878e-02, 9.102040816326530948e-01, 4.856673930057646138e-01], 
-[5.462277217684342878e-02, 9.122448979591837315e-01, 4.973846991965412689e-01], 
-[5.462277217684342878e-02, 9.142857142857142572e-01, 5.096467435091218690e-01], 
-[5.462277217684342878e-02, 9.163265306122448939e-01, 5.224926478928670903e-01], 
-[5.462277217684342878e-02, 9.183673469387755306e-01, 5.359653920601461508e-01], 
-[5.462277217684342878e-02, 9.204081632653061673e-01, 5.501123025180576498e-01], 
-[5.462277217684342878e-02, 9.224489795918368040e-01, 5.649856180853451981e-01], 
-[5.462277217684342878e-02, 9.244897959183673297e-01, 5.806431462459791248e-01], 
-[5.462277217684342878e-02, 9.265306122448979664e-01, 5.971490278568488685e-01], 
-[5.462277217684342878e-02, 9.285714285714286031e-01, 6.145746317017823923e-01], 
-[5.462277217684342878e-02, 9.306122448979592399e-01, 6.329996054042669185e-01], 
-[5.462277217684342878e-02, 9.326530612244897656e-01, 6.525131155912102798e-01], 
-[5.462277217684342878e-02, 9.346938775510204023e-01, 6.732153183627849202e-01], 
-[5.462277217684342878e-02, 9.367346938775510390e-01, 6.952191116401256199e-01], 
-[5.462277217684342878e-02, 9.387755102040816757e-01, 7.186522346133521477e-01], 
-[5.462277217684342878e-02, 9.408163265306123124e-01, 7.436597973711309706e-01], 
-[5.462277217684342878e-02, 9.428571428571428381e-01, 7.704073473536128258e-01], 
-[5.462277217684342878e-02, 9.448979591836734748e-01, 7.990846106316257247e-01], 
-[5.462277217684342878e-02, 9.469387755102041115e-01, 8.299100881583081346e-01], 
-[5.462277217684342878e-02, 9.489795918367347483e-01, 8.631367443507345083e-01], 
-[5.462277217684342878e-02, 9.510204081632652739e-01, 8.990591038777908661e-01], 
-[5.462277217684342878e-02, 9.530612244897959107e-01, 9.380221815623164261e-01], 
-[5.462277217684342878e-02, 9.551020408163265474e-01, 9.804328236312110922e-01], 
-[5.462277217684342878e-02, 9.571428571428571841e-01, 1.026774257125602219e+00], 
-[5.462277217684342878e-02, 9.591836734693878208e-01, 1.077624960528421383e+00], 
-[5.462277217684342878e-02, 9.612244897959183465e-01, 1.133683433649854688e+00], 
-[5.462277217684342878e-02, 9.632653061224489832e-01, 1.195801140619720204e+00], 
-[5.462277217684342878e-02, 9.653061224489796199e-01, 1.265026961348180379e+00], 
-[5.462277217684342878e-02, 9.673469387755102566e-01, 1.342668141061092335e+00], 
-[5.462277217684342878e-02, 9.693877551020407823e-01, 1.430375366955211724e+00], 
-[5.462277217684342878e-02, 9.714285714285714191e-01, 1.530263924496505945e+00], 
-[5.462277217684342878e-02, 9.734693877551020558e-01, 1.645090179708584621e+00], 
-[5.462277217684342878e-02, 9.755102040816326925e-01, 1.778515355516865792e+00], 
-[5.462277217684342878e-02, 9.775510204081632182e-01, 1.935511618149538871e+00], 
-[5.462277217684342878e-02, 9.795918367346938549e-01, 2.123009112436539336e+00], 
-[5.462277217684342878e-02, 9.816326530612244916e-01, 2.350969466876220437e+00], 
-[5.462277217684342878e-02, 9.836734693877551283e-01, 2.634255071768512479e+00], 
-[5.462277217684342878e-02, 9.857142857142857650e-01, 2.996081390374813580e+00], 
-[5.462277217684342878e-02, 9.877551020408162907e-01, 3.474878553808767201e+00], 
-[5.462277217684342878e-02, 9.897959183673469274e-01, 4.139278921882803886e+00], 
-[5.462277217684342878e-02, 9.918367346938775642e-01, 5.125270340995840890e+00], 
-[5.462277217684342878e-02, 9.938775510204082009e-01, 6.746504124237757694e+00], 
-[5.462277217684342878e-02, 9.959183673469387266e-01, 9.929517116505952146e+00], 
-[5.462277217684342878e-02, 9.979591836734693633e-01, 1.919548645614069216e+01], 
-[5.462277217684342878e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[5.994842503189411892e-02, 1.000000000000000021e-03, 2.886375953194956351e-02], 
-[5.994842503189411892e-02, 1.148922311909569708e-03, 2.884176881508564855e-02], 
-[5.994842503189411892e-02, 1.320022478803632065e-03, 2.882038013702090812e-02], 
-[5.994842503189411892e-02, 1.516603278119670137e-03, 2.879968352084440186e-02], 
-[5.994842503189411892e-02, 1.742459344546885402e-03, 2.877978261418925876e-02], 
-[5.994842503189411892e-02, 2.001950418545241171e-03, 2.876079680317746370e-02], 
-[5.994842503189411892e-02, 2.300085503203331758e-03, 2.874286367048604907e-02], 
-[5.994842503189411892e-02, 2.642619553930058204e-03, 2.872614185890524571e-02], 
-[5.994842503189411892e-02, 3.036164567398761706e-03, 2.871081441372054510e-02], 
-[5.994842503189411892e-02, 3.488317214113704091e-03, 2.869709269269572066e-02], 
-[5.994842503189411892e-02, 4.007805478313466660e-03, 2.868522095131853522e-02], 
-[5.994842503189411892e-02, 4.604657135827751671e-03, 2.867548173495597721e-02], 
-[5.994842503189411892e-02, 5.290393322046124149e-03, 2.866820223901004813e-02], 
-[5.994842503189411892e-02, 6.078250926476181683e-03, 2.866376183650569398e-02], 
-[5.994842503189411892e-02, 6.983438106813499684e-03, 2.866260102037071836e-02], 
-[5.994842503189411892e-02, 8.023427854757562983e-03, 2.866523206957798803e-02], 
-[5.994842503189411892e-02, 9.218295280327699903e-03, 2.867225182794722396e-02], 
-[5.994842503189411892e-02, 1.059110512533918171e-02, 2.868435708779665250e-02], 
-[5.994842503189411892e-02, 1.216835698628199354e-02, 2.870236320567567945e-02], 
-[5.994842503189411892e-02, 1.398049684082008047e-02, 2.872722675512954377e-02], 
-[5.994842503189411892e-02, 1.606250475199945058e-02, 2.876007325648501090e-02], 
-[5.994842503189411892e-02, 1.845457009472566828e-02, 2.880223133751473596e-02], 
-[5.994842503189411892e-02, 2.120286733852943389e-02, 2.885527510016520220e-02], 
-[5.994842503189411892e-02, 2.436044736169515681e-02, 2.892107703934803167e-02], 
-[5.994842503189411892e-02, 2.798826150195019707e-02, 2.900187463925620046e-02], 
-[5.994842503189411892e-02, 3.215633811115024138e-02, 2.910035484679869555e-02], 
-[5.994842503189411892e-02, 3.694513432520856594e-02, 2.921976211639191676e-02], 
-[5.994842503189411892e-02, 4.244708914272822542e-02, 2.936403782221939235e-02], 
-[5.994842503189411892e-02, 4.876840779169493850e-02, 2.953800182414435122e-02], 
-[5.994842503189411892e-02, 5.603111182818285713e-02, 2.974759128117743928e-02], 
-[5.994842503189411892e-02, 6.437539454049952259e-02, 3.000017809933658297e-02], 
-[5.994842503189411892e-02, 7.396232712556144451e-02, 3.030499573604340108e-02], 
-[5.994842503189411892e-02, 8.497696787531199003e-02, 3.067372016932363998e-02], 
-[5.994842503189411892e-02, 9.763193439036874088e-02, 3.112127150013697247e-02], 
-[5.994842503189411892e-02, 1.121715077759858903e-01, 3.166693667174334814e-02], 
-[5.994842503189411892e-02, 1.288763480443681220e-01, 3.233596848306936195e-02], 
-[5.994842503189411892e-02, 1.480689117455977755e-01, 3.316190637432084309e-02], 
-[5.994842503189411892e-02, 1.701196764046864207e-01, 3.419001808690573518e-02], 
-[5.994842503189411892e-02, 1.954542919161802172e-01, 3.548253170312572202e-02], 
-[5.994842503189411892e-02, 2.245617969409859638e-01, 3.712682247120344114e-02], 
-[5.994842503189411892e-02, 2.580040589080049296e-01, 3.924866645205782323e-02], 
-[5.994842503189411892e-02, 2.964266198426381838e-01, 4.203458606706370060e-02], 
-[5.994842503189411892e-02, 3.405711573811430193e-01, 4.577142487543436888e-02], 
-[5.994842503189411892e-02, 3.912898015080607528e-01, 5.092082564220188484e-02], 
-[5.994842503189411892e-02, 4.495615833752782953e-01, 5.827057943998580070e-02], 
-[5.994842503189411892e-02, 5.165113337172515529e-01, 6.927456797850571613e-02], 
-[5.994842503189411892e-02, 5.934313956619206021e-01, 8.692787511391461552e-02], 
-[5.994842503189411892e-02, 6.818065710636164178e-01, 1.185146679066339526e-01], 
-[5.994842503189411892e-02, 7.833427819015473803e-01, 1.875473505653461603e-01], 
-[5.994842503189411892e-02, 9.000000000000000222e-01, 4.373764830176255503e-01], 
-[5.994842503189411892e-02, 9.020408163265306589e-01, 4.469162481922847041e-01], 
-[5.994842503189411892e-02, 9.040816326530612956e-01, 4.568526293527236937e-01], 
-[5.994842503189411892e-02, 9.061224489795918213e-01, 4.672110108426578701e-01], 
-[5.994842503189411892e-02, 9.081632653061224580e-01, 4.780190018387508455e-01], 
-[5.994842503189411892e-02, 9.102040816326530948e-01, 4.893066863249702636e-01], 
-[5.994842503189411892e-02, 9.122448979591837315e-01, 5.011069076167502523e-01], 
-[5.994842503189411892e-02, 9.142857142857142572e-01, 5.134555931460587086e-01], 
-[5.994842503189411892e-02, 9.163265306122448939e-01, 5.263921263246705839e-01], 
-[5.994842503189411892e-02, 9.183673469387755306e-01, 5.399597736566232875e-01], 
-[5.994842503189411892e-02, 9.204081632653061673e-01, 5.542061769345907329e-01], 
-[5.994842503189411892e-02, 9.224489795918368040e-01, 5.691839224103326655e-01], 
-[5.994842503189411892e-02, 9.244897959183673297e-01, 5.849512013814320843e-01], 
-[5.994842503189411892e-02, 9.265306122448979664e-01, 6.015725798223340304e-01], 
-[5.994842503189411892e-02, 9.285714285714286031e-01, 6.191198986873198695e-01], 
-[5.994842503189411892e-02, 9.306122448979592399e-01, 6.376733315645242151e-01], 
-[5.994842503189411892e-02, 9.326530612244897656e-01, 6.573226327798102897e-01], 
-[5.994842503189411892e-02, 9.346938775510204023e-01, 6.781686172627443554e-01], 
-[5.994842503189411892e-02, 9.367346938775510390e-01, 7.003249240688840249e-01], 
-[5.994842503189411892e-02, 9.387755102040816757e-01, 7.239201291877995770e-01], 
-[5.994842503189411892e-02, 9.408163265306123124e-01, 7.491002912352937582e-01], 
-[5.994842503189411892e-02, 9.428571428571428381e-01, 7.760320373341310640e-01], 
-[5.994842503189411892e-02, 9.448979591836734748e-01, 8.049063280414889832e-01], 
-[5.994842503189411892e-02, 9.469387755102041115e-01, 8.359430825831785095e-01], 
-[5.994842503189411892e-02, 9.489795918367347483e-01, 8.693969032161831256e-01], 
-[5.994842503189411892e-02, 9.510204081632652739e-01, 9.055642165391091236e-01], 
-[5.994842503189411892e-02, 9.530612244897959107e-01, 9.447922592655599860e-01], 
-[5.994842503189411892e-02, 9.551020408163265474e-01, 9.874904902323131672e-01], 
-[5.994842503189411892e-02, 9.571428571428571841e-01, 1.034145230315473452e+00], 
-[5.994842503189411892e-02, 9.591836734693878208e-01, 1.085338650082091405e+00], 
-[5.994842503189411892e-02, 9.612244897959183465e-01, 1.141773692785363004e+00], 
-[5.994842503189411892e-02, 9.632653061224489832e-01, 1.204307220292818670e+00], 
-[5.994842503189411892e-02, 9.653061224489796199e-01, 1.273994737392791787e+00], 
-[5.994842503189411892e-02, 9.673469387755102566e-01, 1.352151714018753559e+00], 
-[5.994842503189411892e-02, 9.693877551020407823e-01, 1.440439180024189803e+00], 
-[5.994842503189411892e-02, 9.714285714285714191e-01, 1.540985616154868731e+00], 
-[5.994842503189411892e-02, 9.734693877551020558e-01, 1.656564501579613768e+00], 
-[5.994842503189411892e-02, 9.755102040816326925e-01, 1.790859674515232758e+00], 
-[5.994842503189411892e-02, 9.775510204081632182e-01, 1.948873844623837170e+00], 
-[5.994842503189411892e-02, 9.795918367346938549e-01, 2.137579471318244995e+00], 
-[5.994842503189411892e-02, 9.816326530612244916e-01, 2.366998604250400540e+00], 
-[5.994842503189411892e-02, 9.836734693877551283e-01, 2.652083115591062246e+00], 
-[5.994842503189411892e-02, 9.857142857142857650e-01, 3.016187082767213479e+00], 
-[5.994842503189411892e-02, 9.877551020408162907e-01, 3.497967919643448997e+00], 
-[5.994842503189411892e-02, 9.897959183673469274e-01, 4.166459400867585039e+00], 
-[5.994842503189411892e-02, 9.918367346938775642e-01, 5.158434165753674527e+00], 
-[5.994842503189411892e-02, 9.938775510204082009e-01, 6.789323427456646520e+00], 
-[5.994842503189411892e-02, 9.959183673469387266e-01, 9.990803052409958696e+00], 
-[5.994842503189411892e-02, 9.979591836734693633e-01, 1.930821271624439817e+01], 
-[5.994842503189411892e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[6.579332246575682330e-02, 1.000000000000000021e-03, 2.912164711072044027e-02], 
-[6.579332246575682330e-02, 1.148922311909569708e-03, 2.909924497176157032e-02], 
-[6.579332246575682330e-02, 1.320022478803632065e-03, 2.907744988877622797e-02], 
-[6.579332246575682330e-02, 1.516603278119670137e-03, 2.905635263048648304e-02], 
-[6.579332246575682330e-02, 1.742459344546885402e-03, 2.903605770234018307e-02], 
-[6.579332246575682330e-02, 2.001950418545241171e-03, 2.901668547775949902e-02], 
-[6.579332246575682330e-02, 2.300085503203331758e-03, 2.899837467632874338e-02], 
-[6.579332246575682330e-02, 2.642619553930058204e-03, 2.898128525076987261e-02], 
-[6.579332246575682330e-02, 3.036164567398761706e-03, 2.896560175664384534e-02], 
-[6.579332246575682330e-02, 3.488317214113704091e-03, 2.895153729427273059e-02], 
-[6.579332246575682330e-02, 4.007805478313466660e-03, 2.893933813142308964e-02], 
-[6.579332246575682330e-02, 4.604657135827751671e-03, 2.892928913945169017e-02], 
-[6.579332246575682330e-02, 5.290393322046124149e-03, 2.892172020533265164e-02], 
-[6.579332246575682330e-02, 6.078250926476181683e-03, 2.891701382059504166e-02], 
-[6.579332246575682330e-02, 6.983438106813499684e-03, 2.891561409644324149e-02], 
-[6.579332246575682330e-02, 8.023427854757562983e-03, 2.891803751673117234e-02], 
-[6.579332246575682330e-02, 9.218295280327699903e-03, 2.892488582073267367e-02], 
-[6.579332246575682330e-02, 1.059110512533918171e-02, 2.893686151187579991e-02], 
-[6.579332246575682330e-02, 1.216835698628199354e-02, 2.895478662473834411e-02], 
-[6.579332246575682330e-02, 1.398049684082008047e-02, 2.897962556174139490e-02], 
-[6.579332246575682330e-02, 1.606250475199945058e-02, 2.901251304791562652e-02], 
-[6.579332246575682330e-02, 1.845457009472566828e-02, 2.905478856847973357e-02], 
-[6.579332246575682330e-02, 2.120286733852943389e-02, 2.910803907867738974e-02], 
-[6.579332246575682330e-02, 2.436044736169515681e-02, 2.917415235068245016e-02], 
-[6.579332246575682330e-02, 2.798826150195019707e-02, 2.925538410805066797e-02], 
-[6.579332246575682330e-02, 3.215633811115024138e-02, 2.935444318086155926e-02], 
-[6.579332246575682330e-02, 3.694513432520856594e-02, 2.947460042118675572e-02], 
-[6.579332246575682330e-02, 4.244708914272822542e-02, 2.961982923701569903e-02], 
-[6.579332246575682330e-02, 4.876840779169493850e-02, 2.979498861643073773e-02], 
-[6.579332246575682330e-02, 5.603111182818285713e-02, 3.000606385543524990e-02], 
-[6.579332246575682330e-02, 6.437539454049952259e-02, 3.026048654514555680e-02], 
-[6.579332246575682330e-02, 7.396232712556144451e-02, 3.056756478243510822e-02], 
-[6.579332246575682330e-02, 8.497696787531199003e-02, 3.093906876407871015e-02], 
-[6.579332246575682330e-02, 9.763193439036874088e-02, 3.139003875301872581e-02], 
-[6.579332246575682330e-02, 1.121715077759858903e-01, 3.193991668457614452e-02], 
-[6.579332246575682330e-02, 1.288763480443681220e-01, 3.261415779601525844e-02], 
-[6.579332246575682330e-02, 1.480689117455977755e-01, 3.344656965920054376e-02], 
-[6.579332246575682330e-02, 1.701196764046864207e-01, 3.448278079784691807e-02], 
-[6.579332246575682330e-02, 1.954542919161802172e-01, 3.578551353925105150e-02], 
-[6.579332246575682330e-02, 2.245617969409859638e-01, 3.744283441361969528e-02], 
-[6.579332246575682330e-02, 2.580040589080049296e-01, 3.958151021724320984e-02], 
-[6.579332246575682330e-02, 2.964266198426381838e-01, 4.238952530539029373e-02], 
-[6.579332246575682330e-02, 3.405711573811430193e-01, 4.615595872996043625e-02], 
-[6.579332246575682330e-02, 3.912898015080607528e-01, 5.134602756662753897e-02], 
-[6.579332246575682330e-02, 4.495615833752782953e-01, 5.875357609210341003e-02], 
-[6.579332246575682330e-02, 5.165113337172515529e-01, 6.984355670346475975e-02], 
-[6.579332246575682330e-02, 5.934313956619206021e-01, 8.763360951934009990e-02], 
-[6.579332246575682330e-02, 6.818065710636164178e-01, 1.194619943520752320e-01], 
-[6.579332246575682330e-02, 7.833427819015473803e-01, 1.890123508122273088e-01], 
-[6.579332246575682330e-02, 9.000000000000000222e-01, 4.406443357832209307e-01], 
-[6.579332246575682330e-02, 9.020408163265306589e-01, 4.502514262539958900e-01], 
-[6.579332246575682330e-02, 9.040816326530612956e-01, 4.602578381430042498e-01], 
-[6.579332246575682330e-02, 9.061224489795918213e-01, 4.706891249654577836e-01], 
-[6.579332246575682330e-02, 9.081632653061224580e-01, 4.815730796361119559e-01], 
-[6.579332246575682330e-02, 9.102040816326530948e-01, 4.929399860567638680e-01], 
-[6.579332246575682330e-02, 9.122448979591837315e-01, 5.048229054737867205e-01], 
-[6.579332246575682330e-02, 9.142857142857142572e-01, 5.172580033528142440e-01], 
-[6.579332246575682330e-02, 9.163265306122448939e-01, 5.302849236308023739e-01], 
-[6.579332246575682330e-02, 9.183673469387755306e-01, 5.439472185678027039e-01], 
-[6.579332246575682330e-02, 9.204081632653061673e-01, 5.582928440949175286e-01], 
-[6.579332246575682330e-02, 9.224489795918368040e-01, 5.733747326230809183e-01], 
-[6.579332246575682330e-02, 9.244897959183673297e-01, 5.892514578452183738e-01], 
-[6.579332246575682330e-02, 9.265306122448979664e-01, 6.059880092698617382e-01], 
-[6.579332246575682330e-02, 9.285714285714286031e-01, 6.236566982486448918e-01], 
-[6.579332246575682330e-02, 9.306122448979592399e-01, 6.423382223427607229e-01], 
-[6.579332246575682330e-02, 9.326530612244897656e-01, 6.621229213326973451e-01], 
-[6.579332246575682330e-02, 9.346938775510204023e-01, 6.831122664394989608e-01], 
-[6.579332246575682330e-02, 9.367346938775510390e-01, 7.054206349726876990e-01], 
-[6.579332246575682330e-02, 9.387755102040816757e-01, 7.291774364392644703e-01], 
-[6.579332246575682330e-02, 9.408163265306123124e-01, 7.545296742270475310e-01], 
-[6.579332246575682330e-02, 9.428571428571428381e-01, 7.816450508259216168e-01], 
-[6.579332246575682330e-02, 9.448979591836734748e-01, 8.107157562963764885e-01], 
-[6.579332246575682330e-02, 9.469387755102041115e-01, 8.419631223537880071e-01], 
-[6.579332246575682330e-02, 9.489795918367347483e-01, 8.756433823467280053e-01], 
-[6.579332246575682330e-02, 9.510204081632652739e-01, 9.120548568824983215e-01], 
-[6.579332246575682330e-02, 9.530612244897959107e-01, 9.515469952088529970e-01], 
-[6.579332246575682330e-02, 9.551020408163265474e-01, 9.945318576437784941e-01], 
-[6.579332246575682330e-02, 9.571428571428571841e-01, 1.041498845562786935e+00], 
-[6.579332246575682330e-02, 9.591836734693878208e-01, 1.093033805506071543e+00], 
-[6.579332246575682330e-02, 9.612244897959183465e-01, 1.149844104531150712e+00], 
-[6.579332246575682330e-02, 9.632653061224489832e-01, 1.212791978067842447e+00], 
-[6.579332246575682330e-02, 9.653061224489796199e-01, 1.282939525696978667e+00], 
-[6.579332246575682330e-02, 9.673469387755102566e-01, 1.361610404163206667e+00], 
-[6.579332246575682330e-02, 9.693877551020407823e-01, 1.450475937591327202e+00], 
-[6.579332246575682330e-02, 9.714285714285714191e-01, 1.551677739280389545e+00], 
-[6.579332246575682330e-02, 9.734693877551020558e-01, 1.668006318806714017e+00], 
-[6.579332246575682330e-02, 9.755102040816326925e-01, 1.803168018361199998e+00], 
-[6.579332246575682330e-02, 9.775510204081632182e-01, 1.962195937797621914e+00], 
-[6.579332246575682330e-02, 9.795918367346938549e-01, 2.152104634416339923e+00], 
-[6.579332246575682330e-02, 9.816326530612244916e-01, 2.382976262681977708e+00], 
-[6.579332246575682330e-02, 9.836734693877551283e-01, 2.669851696725707768e+00], 
-[6.579332246575682330e-02, 9.857142857142857650e-01, 3.036222864763075791e+00], 
-[6.579332246575682330e-02, 9.877551020408162907e-01, 3.520973174185862309e+00], 
-[6.579332246575682330e-02, 9.897959183673469274e-01, 4.193535459855043612e+00], 
-[6.579332246575682330e-02, 9.918367346938775642e-01, 5.191462367217893892e+00], 
-[6.579332246575682330e-02, 9.938775510204082009e-01, 6.831953627594471001e+00], 
-[6.579332246575682330e-02, 9.959183673469387266e-01, 1.005178919033368246e+01], 
-[6.579332246575682330e-02, 9.979591836734693633e-01, 1.942029097743582966e+01], 
-[6.579332246575682330e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[7.220809018385467015e-02, 1.000000000000000021e-03, 2.937988917510369821e-02], 
-[7.220809018385467015e-02, 1.148922311909569708e-03, 2.935707157627072059e-02], 
-[7.220809018385467015e-02, 1.320022478803632065e-03, 2.933486605153137056e-02], 
-[7.220809018385467015e-02, 1.516603278119670137e-03, 2.931336411530989505e-02], 
-[7.220809018385467015e-02, 1.742459344546885402e-03, 2.929267113093761421e-02], 
-[7.220809018385467015e-02, 2.001950418545241171e-03, 2.927290845920433454e-02], 
-[7.220809018385467015e-02, 2.300085503203331758e-03, 2.925421595666542057e-02], 
-[7.220809018385467015e-02, 2.642619553930058204e-03, 2.923675488603214717e-02], 
-[7.220809018385467015e-02, 3.036164567398761706e-03, 2.922071131318932508e-02], 
-[7.220809018385467015e-02, 3.488317214113704091e-03, 2.920630008105245395e-02], 
-[7.220809018385467015e-02, 4.007805478313466660e-03, 2.919376946968342545e-02], 
-[7.220809018385467015e-02, 4.604657135827751671e-03, 2.918340667642081721e-02], 
-[7.220809018385467015e-02, 5.290393322046124149e-03, 2.917554427977014572e-02], 
-[7.220809018385467015e-02, 6.078250926476181683e-03, 2.917056788968121553e-02], 
-[7.220809018385467015e-02, 6.983438106813499684e-03, 2.916892523549654073e-02], 
-[7.220809018385467015e-02, 8.023427854757562983e-03, 2.917113700574189283e-02], 
-[7.220809018385467015e-02, 9.218295280327699903e-03, 2.917780983484552851e-02], 
-[7.220809018385467015e-02, 1.059110512533918171e-02, 2.918965193693019711e-02], 
-[7.220809018385467015e-02, 1.216835698628199354e-02, 2.920749202403951847e-02], 
-[7.220809018385467015e-02, 1.398049684082008047e-02, 2.923230232672000689e-02], 
-[7.220809018385467015e-02, 1.606250475199945058e-02, 2.926522677371484749e-02], 
-[7.220809018385467015e-02, 1.845457009472566828e-02, 2.930761570638813762e-02], 
-[7.220809018385467015e-02, 2.120286733852943389e-02, 2.936106893158045919e-02], 
-[7.220809018385467015e-02, 2.436044736169515681e-02, 2.942748949650834944e-02], 
-[7.220809018385467015e-02, 2.798826150195019707e-02, 2.950915136119106053e-02], 
-[7.220809018385467015e-02, 3.215633811115024138e-02, 2.960878523508232371e-02], 
-[7.220809018385467015e-02, 3.694513432520856594e-02, 2.972968836291795328e-02], 
-[7.220809018385467015e-02, 4.244708914272822542e-02, 2.987586617989589771e-02], 
-[7.220809018385467015e-02, 4.876840779169493850e-02, 3.005221679353744721e-02], 
-[7.220809018385467015e-02, 5.603111182818285713e-02, 3.026477362505911733e-02], 
-[7.220809018385467015e-02, 6.437539454049952259e-02, 3.052102793473360220e-02], 
-[7.220809018385467015e-02, 7.396232712556144451e-02, 3.083036243707830068e-02], 
-[7.220809018385467015e-02, 8.497696787531199003e-02, 3.120464151746670661e-02], 
-[7.220809018385467015e-02, 9.763193439036874088e-02, 3.165902555862275258e-02], 
-[7.220809018385467015e-02, 1.121715077759858903e-01, 3.221311142807874867e-02], 
-[7.220809018385467015e-02, 1.288763480443681220e-01, 3.289255671532974323e-02], 
-[7.220809018385467015e-02, 1.480689117455977755e-01, 3.373143699804595497e-02], 
-[7.220809018385467015e-02, 1.701196764046864207e-01, 3.477574139505515416e-02], 
-[7.220809018385467015e-02, 1.954542919161802172e-01, 3.608868619467156535e-02], 
-[7.220809018385467015e-02, 2.245617969409859638e-01, 3.775902876844599437e-02], 
-[7.220809018385467015e-02, 2.580040589080049296e-01, 3.991452594604132792e-02], 
-[7.220809018385467015e-02, 2.964266198426381838e-01, 4.274462286251828197e-02], 
-[7.220809018385467015e-02, 3.405711573811430193e-01, 4.654063209088390302e-02], 
-[7.220809018385467015e-02, 3.912898015080607528e-01, 5.177134148359856941e-02], 
-[7.220809018385467015e-02, 4.495615833752782953e-01, 5.923664178218782106e-02], 
-[7.220809018385467015e-02, 5.165113337172515529e-01, 7.041254210535702329e-02], 
-[7.220809018385467015e-02, 5.934313956619206021e-01, 8.833920629970058724e-02], 
-[7.220809018385467015e-02, 6.818065710636164178e-01, 1.204088964242213955e-01], 
-[7.220809018385467015e-02, 7.833427819015473803e-01, 1.904761460829571540e-01], 
-[7.220809018385467015e-02, 9.000000000000000222e-01, 4.439071320636064355e-01], 
-[7.220809018385467015e-02, 9.020408163265306589e-01, 4.535813791983990817e-01], 
-[7.220809018385467015e-02, 9.040816326530612956e-01, 4.636576448632038217e-01], 
-[7.220809018385467015e-02, 9.061224489795918213e-01, 4.741616511583269800e-01], 
-[7.220809018385467015e-02, 9.081632653061224580e-01, 4.851213740953795317e-01], 
-[7.220809018385467015e-02, 9.102040816326530948e-01, 4.965672967914499525e-01], 
-[7.220809018385467015e-02, 9.122448979591837315e-01, 5.085326976526157727e-01], 
-[7.220809018385467015e-02, 9.142857142857142572e-01, 5.210539793297647160e-01], 
-[7.220809018385467015e-02, 9.163265306122448939e-01, 5.341710453496844035e-01], 
-[7.220809018385467015e-02, 9.183673469387755306e-01, 5.479277326948943649e-01], 
-[7.220809018385467015e-02, 9.204081632653061673e-01, 5.623723102901316828e-01], 
-[7.220809018385467015e-02, 9.224489795918368040e-01, 5.775580554343043849e-01], 
-[7.220809018385467015e-02, 9.244897959183673297e-01, 5.935439228003799306e-01], 
-[7.220809018385467015e-02, 9.265306122448979664e-01, 6.103953238508565970e-01], 
-[7.220809018385467015e-02, 9.285714285714286031e-01, 6.281850385654113023e-01], 
-[7.220809018385467015e-02, 9.306122448979592399e-01, 6.469942864910056546e-01], 
-[7.220809018385467015e-02, 9.326530612244897656e-01, 6.669139906233213511e-01], 
-[7.220809018385467015e-02, 9.346938775510204023e-01, 6.880462759425667318e-01], 
-[7.220809018385467015e-02, 9.367346938775510390e-01, 7.105062551381928770e-01], 
-[7.220809018385467015e-02, 9.387755102040816757e-01, 7.344241679600187478e-01], 
-[7.220809018385467015e-02, 9.408163265306123124e-01, 7.599479588213264858e-01], 
-[7.220809018385467015e-02, 9.428571428571428381e-01, 7.872464012735906902e-01], 
-[7.220809018385467015e-02, 9.448979591836734748e-01, 8.165129099092205411e-01], 
-[7.220809018385467015e-02, 9.469387755102041115e-01, 8.479702231637258336e-01], 
-[7.220809018385467015e-02, 9.489795918367347483e-01, 8.818761987451027018e-01], 
-[7.220809018385467015e-02, 9.510204081632652739e-01, 9.185310433675518693e-01], 
-[7.220809018385467015e-02, 9.530612244897959107e-01, 9.582864094793399623e-01], 
-[7.220809018385467015e-02, 9.551020408163265474e-01, 1.001556947778719842e+00], 
-[7.220809018385467015e-02, 9.571428571428571841e-01, 1.048835126838712384e+00], 
-[7.220809018385467015e-02, 9.591836734693878208e-01, 1.100710453102949016e+00], 
-[7.220809018385467015e-02, 9.612244897959183465e-01, 1.157894697845628595e+00], 
-[7.220809018385467015e-02, 9.632653061224489832e-01, 1.221255445947225127e+00], 
-[7.220809018385467015e-02, 9.653061224489796199e-01, 1.291861361776053041e+00], 
-[7.220809018385467015e-02, 9.673469387755102566e-01, 1.371044251094754030e+00], 
-[7.220809018385467015e-02, 9.693877551020407823e-01, 1.460485684048124400e+00], 
-[7.220809018385467015e-02, 9.714285714285714191e-01, 1.562340343938915410e+00], 
-[7.220809018385467015e-02, 9.734693877551020558e-01, 1.679415688250995409e+00], 
-[7.220809018385467015e-02, 9.755102040816326925e-01, 1.815440452158253448e+00], 
-[7.220809018385467015e-02, 9.775510204081632182e-01, 1.975477972922266900e+00], 
-[7.220809018385467015e-02, 9.795918367346938549e-01, 2.166584689698136224e+00], 
-[7.220809018385467015e-02, 9.816326530612244916e-01, 2.398902546412371883e+00], 
-[7.220809018385467015e-02, 9.836734693877551283e-01, 2.687560940786518415e+00], 
-[7.220809018385467015e-02, 9.857142857142857650e-01, 3.056188890965938043e+00], 
-[7.220809018385467015e-02, 9.877551020408162907e-01, 3.543894513029155480e+00], 
-[7.220809018385467015e-02, 9.897959183673469274e-01, 4.220507355708779329e+00], 
-[7.220809018385467015e-02, 9.918367346938775642e-01, 5.224355301302734844e+00], 
-[7.220809018385467015e-02, 9.938775510204082009e-01, 6.874395260968428900e+00], 
-[7.220809018385467015e-02, 9.959183673469387266e-01, 1.011247647015647999e+01], 
-[7.220809018385467015e-02, 9.979591836734693633e-01, 1.953172360410153630e+01], 
-[7.220809018385467015e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[7.924828983539176919e-02, 1.000000000000000021e-03, 2.963848597034166379e-02], 
-[7.924828983539176919e-02, 1.148922311909569708e-03, 2.961524886698641348e-02], 
-[7.924828983539176919e-02, 1.320022478803632065e-03, 2.959262885678214799e-02], 
-[7.924828983539176919e-02, 1.516603278119670137e-03, 2.957071819992312944e-02], 
-[7.924828983539176919e-02, 1.742459344546885402e-03, 2.954962311769158967e-02], 
-[7.924828983539176919e-02, 2.001950418545241171e-03, 2.952946595831085208e-02], 
-[7.924828983539176919e-02, 2.300085503203331758e-03, 2.951038771536917266e-02], 
-[7.924828983539176919e-02, 2.642619553930058204e-03, 2.949255096162274603e-02], 
-[7.924828983539176919e-02, 3.036164567398761706e-03, 2.947614327332618439e-02], 
-[7.924828983539176919e-02, 3.488317214113704091e-03, 2.946138123602077066e-02], 
-[7.924828983539176919e-02, 4.007805478313466660e-03, 2.944851514207710852e-02], 
-[7.924828983539176919e-02, 4.604657135827751671e-03, 2.943783451480398369e-02], 
-[7.924828983539176919e-02, 5.290393322046124149e-03, 2.942967462419338737e-02], 
-[7.924828983539176919e-02, 6.078250926476181683e-03, 2.942442419852767804e-02], 
-[7.924828983539176919e-02, 6.983438106813499684e-03, 2.942253458514345818e-02], 
-[7.924828983539176919e-02, 8.023427854757562983e-03, 2.942453067702272343e-02], 
-[7.924828983539176919e-02, 9.218295280327699903e-03, 2.943102400344102532e-02], 
-[7.924828983539176919e-02, 1.059110512533918171e-02, 2.944272848879199087e-02], 
-[7.924828983539176919e-02, 1.216835698628199354e-02, 2.946047952201252818e-02], 
-[7.924828983539176919e-02, 1.398049684082008047e-02, 2.948525716101236399e-02], 
-[7.924828983539176919e-02, 1.606250475199945058e-02, 2.951821453724226552e-02], 
-[7.924828983539176919e-02, 1.845457009472566828e-02, 2.956071284689498757e-02], 
-[7.924828983539176919e-02, 2.120286733852943389e-02, 2.961436474668899255e-02], 
-[7.924828983539176919e-02, 2.436044736169515681e-02, 2.968108855664182422e-02], 
-[7.924828983539176919e-02, 2.798826150195019707e-02, 2.976317647031070240e-02], 
-[7.924828983539176919e-02, 3.215633811115024138e-02, 2.986338107269603109e-02], 
-[7.924828983539176919e-02, 3.694513432520856594e-02, 2.998502599616965220e-02], 
-[7.924828983539176919e-02, 4.244708914272822542e-02, 3.013214869649593480e-02], 
-[7.924828983539176919e-02, 4.876840779169493850e-02, 3.030968639180108698e-02], 
-[7.924828983539176919e-02, 5.603111182818285713e-02, 3.052372061667094072e-02], 
-[7.924828983539176919e-02, 6.437539454049952259e-02, 3.078180228450980854e-02], 
-[7.924828983539176919e-02, 7.396232712556144451e-02, 3.109338870557646489e-02], 
-[7.924828983539176919e-02, 8.497696787531199003e-02, 3.147043842357075127e-02], 
-[7.924828983539176919e-02, 9.763193439036874088e-02, 3.192823189864650579e-02], 
-[7.924828983539176919e-02, 1.121715077759858903e-01, 3.248652087050865611e-02], 
-[7.924828983539176919e-02, 1.288763480443681220e-01, 3.317116519453694456e-02], 
-[7.924828983539176919e-02, 1.480689117455977755e-01, 3.401650832804922753e-02], 
-[7.924828983539176919e-02, 1.701196764046864207e-01, 3.506889979739933466e-02], 
-[7.924828983539176919e-02, 1.954542919161802172e-01, 3.639204956743148645e-02], 
-[7.924828983539176919e-02, 2.245617969409859638e-01, 3.807540540973268495e-02], 
-[7.924828983539176919e-02, 2.580040589080049296e-01, 4.024771348445922714e-02], 
-[7.924828983539176919e-02, 2.964266198426381838e-01, 4.309987855119888633e-02], 
-[7.924828983539176919e-02, 3.405711573811430193e-01, 4.692544473096134372e-02], 
-[7.924828983539176919e-02, 3.912898015080607528e-01, 5.219676711719893614e-02], 
-[7.924828983539176919e-02, 4.495615833752782953e-01, 5.971977617477088746e-02], 
-[7.924828983539176919e-02, 5.165113337172515529e-01, 7.098152377686327286e-02], 
-[7.924828983539176919e-02, 5.934313956619206021e-01, 8.904466496793786434e-02], 
-[7.924828983539176919e-02, 6.818065710636164178e-01, 1.213553735846389647e-01], 
-[7.924828983539176919e-02, 7.833427819015473803e-01, 1.919387360644080331e-01], 
-[7.924828983539176919e-02, 9.000000000000000222e-01, 4.471648752360510293e-01], 
-[7.924828983539176919e-02, 9.020408163265306589e-01, 4.569061106159443830e-01], 
-[7.924828983539176919e-02, 9.040816326530612956e-01, 4.670520533307150890e-01], 
-[7.924828983539176919e-02, 9.061224489795918213e-01, 4.776285934804921363e-01], 
-[7.924828983539176919e-02, 9.081632653061224580e-01, 4.886638895337500066e-01], 
-[7.924828983539176919e-02, 9.102040816326530948e-01, 5.001886231217060885e-01], 
-[7.924828983539176919e-02, 9.122448979591837315e-01, 5.122362890404325020e-01], 
-[7.924828983539176919e-02, 9.142857142857142572e-01, 5.248435262793518241e-01], 
-[7.924828983539176919e-02, 9.163265306122448939e-01, 5.380504970216206662e-01], 
-[7.924828983539176919e-02, 9.183673469387755306e-01, 5.519013219407802318e-01], 
-[7.924828983539176919e-02, 9.204081632653061673e-01, 5.664445818127629151e-01], 
-[7.924828983539176919e-02, 9.224489795918368040e-01, 5.817338975558856706e-01], 
-[7.924828983539176919e-02, 9.244897959183673297e-01, 5.978286034108241109e-01], 
-[7.924828983539176919e-02, 9.265306122448979664e-01, 6.147945312172677923e-01], 
-[7.924828983539176919e-02, 9.285714285714286031e-01, 6.327049278174101676e-01], 
-[7.924828983539176919e-02, 9.306122448979592399e-01, 6.516415327609882402e-01], 
-[7.924828983539176919e-02, 9.326530612244897656e-01, 6.716958500243379593e-01], 
-[7.924828983539176919e-02, 9.346938775510204023e-01, 6.929706558201089717e-01], 
-[7.924828983539176919e-02, 9.367346938775510390e-01, 7.155817953500644979e-01], 
-[7.924828983539176919e-02, 9.387755102040816757e-01, 7.396603353396202785e-01], 
-[7.924828983539176919e-02, 9.408163265306123124e-01, 7.653551574895287590e-01], 
-[7.924828983539176919e-02, 9.428571428571428381e-01, 7.928361021172718459e-01], 
-[7.924828983539176919e-02, 9.448979591836734748e-01, 8.222978033874105419e-01], 
-[7.924828983539176919e-02, 9.469387755102041115e-01, 8.539644006998110548e-01], 
-[7.924828983539176919e-02, 9.489795918367347483e-01, 8.880953694058688619e-01], 
-[7.924828983539176919e-02, 9.510204081632652739e-01, 9.249927944440611283e-01], 
-[7.924828983539176919e-02, 9.530612244897959107e-01, 9.650105221524873933e-01], 
-[7.924828983539176919e-02, 9.551020408163265474e-01, 1.008565782536389177e+00], 
-[7.924828983539176919e-02, 9.571428571428571841e-01, 1.056154098098018190e+00], 
-[7.924828983539176919e-02, 9.591836734693878208e-01, 1.108368619155927437e+00], 
-[7.924828983539176919e-02, 9.612244897959183465e-01, 1.165925501664305752e+00], 
-[7.924828983539176919e-02, 9.632653061224489832e-01, 1.229697655906329512e+00], 
-[7.924828983539176919e-02, 9.653061224489796199e-01, 1.300760281113271688e+00], 
-[7.924828983539176919e-02, 9.673469387755102566e-01, 1.380453294375643125e+00], 
-[7.924828983539176919e-02, 9.693877551020407823e-01, 1.470468463740734144e+00], 
-[7.924828983539176919e-02, 9.714285714285714191e-01, 1.572973480141999225e+00], 
-[7.924828983539176919e-02, 9.734693877551020558e-01, 1.690792666708158754e+00], 
-[7.924828983539176919e-02, 9.755102040816326925e-01, 1.827677040930471231e+00], 
-[7.924828983539176919e-02, 9.775510204081632182e-01, 1.988720025151816895e+00], 
-[7.924828983539176919e-02, 9.795918367346938549e-01, 2.181019725010263421e+00], 
-[7.924828983539176919e-02, 9.816326530612244916e-01, 2.414777559531152029e+00], 
-[7.924828983539176919e-02, 9.836734693877551283e-01, 2.705210973192946788e+00], 
-[7.924828983539176919e-02, 9.857142857142857650e-01, 3.076085315723972258e+00], 
-[7.924828983539176919e-02, 9.877551020408162907e-01, 3.566732131420761398e+00], 
-[7.924828983539176919e-02, 9.897959183673469274e-01, 4.247375344804078523e+00], 
-[7.924828983539176919e-02, 9.918367346938775642e-01, 5.257113323188955079e+00], 
-[7.924828983539176919e-02, 9.938775510204082009e-01, 6.916648862682430732e+00], 
-[7.924828983539176919e-02, 9.959183673469387266e-01, 1.017286582937079764e+01], 
-[7.924828983539176919e-02, 9.979591836734693633e-01, 1.964251295353036397e+01], 
-[7.924828983539176919e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[8.697490026177834288e-02, 1.000000000000000021e-03, 2.989743774174751997e-02], 
-[8.697490026177834288e-02, 1.148922311909569708e-03, 2.987377708234873613e-02], 
-[8.697490026177834288e-02, 1.320022478803632065e-03, 2.985073853608699937e-02], 
-[8.697490026177834288e-02, 1.516603278119670137e-03, 2.982841510899321424e-02], 
-[8.697490026177834288e-02, 1.742459344546885402e-03, 2.980691388036662073e-02], 
-[8.697490026177834288e-02, 2.001950418545241171e-03, 2.978635818592826126e-02], 
-[8.697490026177834288e-02, 2.300085503203331758e-03, 2.976689015635937061e-02], 
-[8.697490026177834288e-02, 2.642619553930058204e-03, 2.974867367451451694e-02], 
-[8.697490026177834288e-02, 3.036164567398761706e-03, 2.973189782706169362e-02], 
-[8.697490026177834288e-02, 3.488317214113704091e-03, 2.971678094219753347e-02], 
-[8.697490026177834288e-02, 4.007805478313466660e-03, 2.970357532461157662e-02], 
-[8.697490026177834288e-02, 4.604657135827751671e-03, 2.969257282356761729e-02], 
-[8.697490026177834288e-02, 5.290393322046124149e-03, 2.968411140049497660e-02], 
-[8.697490026177834288e-02, 6.078250926476181683e-03, 2.967858290191554074e-02], 
-[8.697490026177834288e-02, 6.983438106813499684e-03, 2.967644229301044656e-02], 
-[8.697490026177834288e-02, 8.023427854757562983e-03, 2.967821867099582067e-02], 
-[8.697490026177834288e-02, 9.218295280327699903e-03, 2.968452845967990000e-02], 
-[8.697490026177834288e-02, 1.059110512533918171e-02, 2.969609129329477126e-02], 
-[8.697490026177834288e-02, 1.216835698628199354e-02, 2.971374923708808985e-02], 
-[8.697490026177834288e-02, 1.398049684082008047e-02, 2.973849017555887236e-02], 
-[8.697490026177834288e-02, 1.606250475199945058e-02, 2.977147644184686276e-02], 
-[8.697490026177834288e-02, 1.845457009472566828e-02, 2.981408008564080669e-02], 
-[8.697490026177834288e-02, 2.120286733852943389e-02, 2.986792661179920802e-02], 
-[8.697490026177834288e-02, 2.436044736169515681e-02, 2.993494961087672657e-02], 
-[8.697490026177834288e-02, 2.798826150195019707e-02, 3.001745950701687621e-02], 
-[8.697490026177834288e-02, 3.215633811115024138e-02, 3.011823075690805984e-02], 
-[8.697490026177834288e-02, 3.694513432520856594e-02, 3.024061337549274059e-02], 
-[8.697490026177834288e-02, 4.244708914272822542e-02, 3.038867683241503609e-02], 
-[8.697490026177834288e-02, 4.876840779169493850e-02, 3.056739744751828247e-02], 
-[8.697490026177834288e-02, 5.603111182818285713e-02, 3.078290485684854333e-02], 
-[8.697490026177834288e-02, 6.437539454049952259e-02, 3.104280961083749624e-02], 
-[8.697490026177834288e-02, 7.396232712556144451e-02, 3.135664359348492441e-02], 
-[8.697490026177834288e-02, 8.497696787531199003e-02, 3.173645947642395049e-02], 
-[8.697490026177834288e-02, 9.763193439036874088e-02, 3.219765775473614616e-02], 
-[8.697490026177834288e-02, 1.121715077759858903e-01, 3.276014498007162601e-02], 
-[8.697490026177834288e-02, 1.288763480443681220e-01, 3.344998318710995511e-02], 
-[8.697490026177834288e-02, 1.480689117455977755e-01, 3.430178358635380120e-02], 
-[8.697490026177834288e-02, 1.701196764046864207e-01, 3.536225592370389331e-02], 
-[8.697490026177834288e-02, 1.954542919161802172e-01, 3.669560355553778963e-02], 
-[8.697490026177834288e-02, 2.245617969409859638e-01, 3.839196421150412736e-02], 
-[8.697490026177834288e-02, 2.580040589080049296e-01, 4.058107267849518640e-02], 
-[8.697490026177834288e-02, 2.964266198426381838e-01, 4.345529218420034201e-02], 
-[8.697490026177834288e-02, 3.405711573811430193e-01, 4.731039642300524650e-02], 
-[8.697490026177834288e-02, 3.912898015080607528e-01, 5.262230419162819417e-02], 
-[8.697490026177834288e-02, 4.495615833752782953e-01, 6.020297893459376770e-02], 
-[8.697490026177834288e-02, 5.165113337172515529e-01, 7.155050131102586031e-02], 
-[8.697490026177834288e-02, 5.934313956619206021e-01, 8.974998503761327795e-02], 
-[8.697490026177834288e-02, 6.818065710636164178e-01, 1.223014252960015064e-01], 
-[8.697490026177834288e-02, 7.833427819015473803e-01, 1.934001204455279010e-01], 
-[8.697490026177834288e-02, 9.000000000000000222e-01, 4.504175686806694001e-01], 
-[8.697490026177834288e-02, 9.020408163265306589e-01, 4.602256240998537917e-01], 
-[8.697490026177834288e-02, 9.040816326530612956e-01, 4.704410673656198583e-01], 
-[8.697490026177834288e-02, 9.061224489795918213e-01, 4.810899559937726888e-01], 
-[8.697490026177834288e-02, 9.081632653061224580e-01, 4.922006302709013292e-01], 
-[8.697490026177834288e-02, 9.102040816326530948e-01, 5.038039696425646863e-01], 
-[8.697490026177834288e-02, 9.122448979591837315e-01, 5.159336845266428995e-01], 
-[8.697490026177834288e-02, 9.142857142857142572e-01, 5.286266494060659626e-01], 
-[8.697490026177834288e-02, 9.163265306122448939e-01, 5.419232841887771102e-01], 
-[8.697490026177834288e-02, 9.183673469387755306e-01, 5.558679922099958315e-01], 
-[8.697490026177834288e-02, 9.204081632653061673e-01, 5.705096649567558131e-01], 
-[8.697490026177834288e-02, 9.224489795918368040e-01, 5.859022657008540191e-01], 
-[8.697490026177834288e-02, 9.244897959183673297e-01, 6.021055068413017075e-01], 
-[8.697490026177834288e-02, 9.265306122448979664e-01, 6.191856390215448869e-01], 
-[8.697490026177834288e-02, 9.285714285714286031e-01, 6.372163741845462415e-01], 
-[8.697490026177834288e-02, 9.306122448979592399e-01, 6.562799699041133028e-01], 
-[8.697490026177834288e-02, 9.326530612244897656e-01, 6.764685089075830327e-01], 
-[8.697490026177834288e-02, 9.346938775510204023e-01, 6.978854161189066430e-01], 
-[8.697490026177834288e-02, 9.367346938775510390e-01, 7.206472663909495591e-01], 
-[8.697490026177834288e-02, 9.387755102040816757e-01, 7.448859501648869008e-01], 
-[8.697490026177834288e-02, 9.408163265306123124e-01, 7.707512826994904476e-01], 
-[8.697490026177834288e-02, 9.428571428571428381e-01, 7.984141667925997998e-01], 
-[8.697490026177834288e-02, 9.448979591836734748e-01, 8.280704512327654587e-01], 
-[8.697490026177834288e-02, 9.469387755102041115e-01, 8.599456706420702812e-01], 
-[8.697490026177834288e-02, 9.489795918367347483e-01, 8.943009113153810308e-01], 
-[8.697490026177834288e-02, 9.510204081632652739e-01, 9.314401285519879892e-01], 
-[8.697490026177834288e-02, 9.530612244897959107e-01, 9.717193532920528343e-01], 
-[8.697490026177834288e-02, 9.551020408163265474e-01, 1.015558383802150910e+00], 
-[8.697490026177834288e-02, 9.571428571428571841e-01, 1.063455783279039668e+00], 
-[8.697490026177834288e-02, 9.591836734693878208e-01, 1.116008329928795284e+00], 
-[8.697490026177834288e-02, 9.612244897959183465e-01, 1.173936544899761181e+00], 
-[8.697490026177834288e-02, 9.632653061224489832e-01, 1.238118639893419637e+00], 
-[8.697490026177834288e-02, 9.653061224489796199e-01, 1.309636319159813489e+00], 
-[8.697490026177834288e-02, 9.673469387755102566e-01, 1.389837573530045445e+00], 
-[8.697490026177834288e-02, 9.693877551020407823e-01, 1.480424320969948138e+00], 
-[8.697490026177834288e-02, 9.714285714285714191e-01, 1.583577197846887330e+00], 
-[8.697490026177834288e-02, 9.734693877551020558e-01, 1.702137310908484746e+00], 
-[8.697490026177834288e-02, 9.755102040816326925e-01, 1.839877849622527206e+00], 
-[8.697490026177834288e-02, 9.775510204081632182e-01, 2.001922169543028929e+00], 
-[8.697490026177834288e-02, 9.795918367346938549e-01, 2.195409828078725312e+00], 
-[8.697490026177834288e-02, 9.816326530612244916e-01, 2.430601405976132945e+00], 
-[8.697490026177834288e-02, 9.836734693877551283e-01, 2.722801919169985485e+00], 
-[8.697490026177834288e-02, 9.857142857142857650e-01, 3.095912293130216320e+00], 
-[8.697490026177834288e-02, 9.877551020408162907e-01, 3.589486224262833147e+00], 
-[8.697490026177834288e-02, 9.897959183673469274e-01, 4.274139683028552739e+00], 
-[8.697490026177834288e-02, 9.918367346938775642e-01, 5.289736787324897271e+00], 
-[8.697490026177834288e-02, 9.938775510204082009e-01, 6.958714966629200305e+00], 
-[8.697490026177834288e-02, 9.959183673469387266e-01, 1.023295820308721460e+01], 
-[8.697490026177834288e-02, 9.979591836734693633e-01, 1.975266137593079563e+01], 
-[8.697490026177834288e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[9.545484566618342437e-02, 1.000000000000000021e-03, 3.015674473470527500e-02], 
-[9.545484566618342437e-02, 1.148922311909569708e-03, 3.013265646086452781e-02], 
-[9.545484566618342437e-02, 1.320022478803632065e-03, 3.010919532106701157e-02], 
-[9.545484566618342437e-02, 1.516603278119670137e-03, 3.008645506724578339e-02], 
-[9.545484566618342437e-02, 1.742459344546885402e-03, 3.006454363678169595e-02], 
-[9.545484566618342437e-02, 2.001950418545241171e-03, 3.004358535295616889e-02], 
-[9.545484566618342437e-02, 2.300085503203331758e-03, 3.002372348360166782e-02], 
-[9.545484566618342437e-02, 2.642619553930058204e-03, 3.000512322172249960e-02], 
-[9.545484566618342437e-02, 3.036164567398761706e-03, 2.998797516444122804e-02], 
-[9.545484566618342437e-02, 3.488317214113704091e-03, 2.997249938263659569e-02], 
-[9.545484566618342437e-02, 4.007805478313466660e-03, 2.995895019332422970e-02], 
-[9.545484566618342437e-02, 4.604657135827751671e-03, 2.994762177170399997e-02], 
-[9.545484566618342437e-02, 5.290393322046124149e-03, 2.993885477058926686e-02], 
-[9.545484566618342437e-02, 6.078250926476181683e-03, 2.993304415464362322e-02], 
-[9.545484566618342437e-02, 6.983438106813499684e-03, 2.993064850673755189e-02], 
-[9.545484566618342437e-02, 8.023427854757562983e-03, 2.993220112809282310e-02], 
-[9.545484566618342437e-02, 9.218295280327699903e-03, 2.993832333672833551e-02], 
-[9.545484566618342437e-02, 1.059110512533918171e-02, 2.994974047627359942e-02], 
-[9.545484566618342437e-02, 1.216835698628199354e-02, 2.996730128769437007e-02], 
-[9.545484566618342437e-02, 1.398049684082008047e-02, 2.999200148129339827e-02], 
-[9.545484566618342437e-02, 1.606250475199945058e-02, 3.002501259086713323e-02], 
-[9.545484566618342437e-02, 1.845457009472566828e-02, 3.006771751825167149e-02], 
-[9.545484566618342437e-02, 2.120286733852943389e-02, 3.012175461468893228e-02], 
-[9.545484566618342437e-02, 2.436044736169515681e-02, 3.018907273898472146e-02], 
-[9.545484566618342437e-02, 2.798826150195019707e-02, 3.027200054289092002e-02], 
-[9.545484566618342437e-02, 3.215633811115024138e-02, 3.037333435089412115e-02], 
-[9.545484566618342437e-02, 3.694513432520856594e-02, 3.049645055540487620e-02], 
-[9.545484566618342437e-02, 4.244708914272822542e-02, 3.064545063321576918e-02], 
-[9.545484566618342437e-02, 4.876840779169493850e-02, 3.082534999694575353e-02], 
-[9.545484566618342437e-02, 5.603111182818285713e-02, 3.104232637212683832e-02], 
-[9.545484566618342437e-02, 6.437539454049952259e-02, 3.130404993003431391e-02], 
-[9.545484566618342437e-02, 7.396232712556144451e-02, 3.162012710631095791e-02], 
-[9.545484566618342437e-02, 8.497696787531199003e-02, 3.200270467000941588e-02], 
-[9.545484566618342437e-02, 9.763193439036874088e-02, 3.246730310848665313e-02], 
-[9.545484566618342437e-02, 1.121715077759858903e-01, 3.303398372492186152e-02], 
-[9.545484566618342437e-02, 1.288763480443681220e-01, 3.372901064647101238e-02], 
-[9.545484566618342437e-02, 1.480689117455977755e-01, 3.458726271005441166e-02], 
-[9.545484566618342437e-02, 1.701196764046864207e-01, 3.565580969274893819e-02], 
-[9.545484566618342437e-02, 1.954542919161802172e-01, 3.699934805696034057e-02], 
-[9.545484566618342437e-02, 2.245617969409859638e-01, 3.870870504775885540e-02], 
-[9.545484566618342437e-02, 2.580040589080049296e-01, 4.091460337413872772e-02], 
-[9.545484566618342437e-02, 2.964266198426381838e-01, 4.381086357430804407e-02], 
-[9.545484566618342437e-02, 3.405711573811430193e-01, 4.769548693988431148e-02], 
-[9.545484566618342437e-02, 3.912898015080607528e-01, 5.304795243120168091e-02], 
-[9.545484566618342437e-02, 4.495615833752782953e-01, 6.068624972660681405e-02], 
-[9.545484566618342437e-02, 5.165113337172515529e-01, 7.211947430124857061e-02], 
-[9.545484566618342437e-02, 5.934313956619206021e-01, 9.045516602291481245e-02], 
-[9.545484566618342437e-02, 6.818065710636164178e-01, 1.232470510220888549e-01], 
-[9.545484566618342437e-02, 7.833427819015473803e-01, 1.948602989173376931e-01], 
-[9.545484566618342437e-02, 9.000000000000000222e-01, 4.536652157804086927e-01], 
-[9.545484566618342437e-02, 9.020408163265306589e-01, 4.635399232461096530e-01], 
-[9.545484566618342437e-02, 9.040816326530612956e-01, 4.738246907906751293e-01], 
-[9.545484566618342437e-02, 9.061224489795918213e-01, 4.845457427625655678e-01], 
-[9.545484566618342437e-02, 9.081632653061224580e-01, 4.957316006289780863e-01], 
-[9.545484566618342437e-02, 9.102040816326530948e-01, 5.074133409513983395e-01], 
-[9.545484566618342437e-02, 9.122448979591837315e-01, 5.196248890028489775e-01], 
-[9.545484566618342437e-02, 9.142857142857142572e-01, 5.324033539164283457e-01], 
-[9.545484566618342437e-02, 9.163265306122448939e-01, 5.457894123951662069e-01], 
-[9.545484566618342437e-02, 9.183673469387755306e-01, 5.598277494087113837e-01], 
-[9.545484566618342437e-02, 9.204081632653061673e-01, 5.745675660174530686e-01], 
-[9.545484566618342437e-02, 9.224489795918368040e-01, 5.900631665833684369e-01], 
-[9.545484566618342437e-02, 9.244897959183673297e-01, 6.063746402573892968e-01], 
-[9.545484566618342437e-02, 9.265306122448979664e-01, 6.235686549166197246e-01], 
-[9.545484566618342437e-02, 9.285714285714286031e-01, 6.417193858468184242e-01], 
-[9.545484566618342437e-02, 9.306122448979592399e-01, 6.609096066714424955e-01], 
-[9.545484566618342437e-02, 9.326530612244897656e-01, 6.812319766440523283e-01], 
-[9.545484566618342437e-02, 9.346938775510204023e-01, 7.027905668843390519e-01], 
-[9.545484566618342437e-02, 9.367346938775510390e-01, 7.257026790414572437e-01], 
-[9.545484566618342437e-02, 9.387755102040816757e-01, 7.501010240198748846e-01], 
-[9.545484566618342437e-02, 9.408163265306123124e-01, 7.761363469154627381e-01], 
-[9.545484566618342437e-02, 9.428571428571428381e-01, 8.039806087306859972e-01], 
-[9.545484566618342437e-02, 9.448979591836734748e-01, 8.338308679415096236e-01], 
-[9.545484566618342437e-02, 9.469387755102041115e-01, 8.659140486637043610e-01], 
-[9.545484566618342437e-02, 9.489795918367347483e-01, 9.004928414517646695e-01], 
-[9.545484566618342437e-02, 9.510204081632652739e-01, 9.378730641214402253e-01], 
-[9.545484566618342437e-02, 9.530612244897959107e-01, 9.784129229500622138e-01], 
-[9.545484566618342437e-02, 9.551020408163265474e-01, 1.022534773447456580e+00], 
-[9.545484566618342437e-02, 9.571428571428571841e-01, 1.070740206303656405e+00], 
-[9.545484566618342437e-02, 9.591836734693878208e-01, 1.123629611665905026e+00], 
-[9.545484566618342437e-02, 9.612244897959183465e-01, 1.181927856441625124e+00], 
-[9.545484566618342437e-02, 9.632653061224489832e-01, 1.246518429829641672e+00], 
-[9.545484566618342437e-02, 9.653061224489796199e-01, 1.318489511334762554e+00], 
-[9.545484566618342437e-02, 9.673469387755102566e-01, 1.399197128044044947e+00], 
-[9.545484566618342437e-02, 9.693877551020407823e-01, 1.490353299991191705e+00], 
-[9.545484566618342437e-02, 9.714285714285714191e-01, 1.594151546956525500e+00], 
-[9.545484566618342437e-02, 9.734693877551020558e-01, 1.713449677516871716e+00], 
-[9.545484566618342437e-02, 9.755102040816326925e-01, 1.852042943099727834e+00], 
-[9.545484566618342437e-02, 9.775510204081632182e-01, 2.015084481055410492e+00], 
-[9.545484566618342437e-02, 9.795918367346938549e-01, 2.209755086508975452e+00], 
-[9.545484566618342437e-02, 9.816326530612244916e-01, 2.446374189533488952e+00], 
-[9.545484566618342437e-02, 9.836734693877551283e-01, 2.740333903748350064e+00], 
-[9.545484566618342437e-02, 9.857142857142857650e-01, 3.115669977022852422e+00], 
-[9.545484566618342437e-02, 9.877551020408162907e-01, 3.612156986112618373e+00], 
-[9.545484566618342437e-02, 9.897959183673469274e-01, 4.300800625782837727e+00], 
-[9.545484566618342437e-02, 9.918367346938775642e-01, 5.322226047427686346e+00], 
-[9.545484566618342437e-02, 9.938775510204082009e-01, 7.000594105492481845e+00], 
-[9.545484566618342437e-02, 9.959183673469387266e-01, 1.029275452403933500e+01], 
-[9.545484566618342437e-02, 9.979591836734693633e-01, 1.986217121444988010e+01], 
-[9.545484566618342437e-02, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.047615752789665122e-01, 1.000000000000000021e-03, 3.041640719466982834e-02], 
-[1.047615752789665122e-01, 1.148922311909569708e-03, 3.039188724110734180e-02], 
-[1.047615752789665122e-01, 1.320022478803632065e-03, 3.036799944340593665e-02], 
-[1.047615752789665122e-01, 1.516603278119670137e-03, 3.034483829946499692e-02], 
-[1.047615752789665122e-01, 1.742459344546885402e-03, 3.032251260481026028e-02], 
-[1.047615752789665122e-01, 2.001950418545241171e-03, 3.030114767034455814e-02], 
-[1.047615752789665122e-01, 2.300085503203331758e-03, 3.028088790110801745e-02], 
-[1.047615752789665122e-01, 2.642619553930058204e-03, 3.026189980030393953e-02], 
-[1.047615752789665122e-01, 3.036164567398761706e-03, 3.024437547554820541e-02], 
-[1.047615752789665122e-01, 3.488317214113704091e-03, 3.022853674042583899e-02], 
-[1.047615752789665122e-01, 4.007805478313466660e-03, 3.021463992428236045e-02], 
-[1.047615752789665122e-01, 4.604657135827751671e-03, 3.020298152823124721e-02], 
-[1.047615752789665122e-01, 5.290393322046124149e-03, 3.019390489641237546e-02], 
-[1.047615752789665122e-01, 6.078250926476181683e-03, 3.018780811152839416e-02], 
-[1.047615752789665122e-01, 6.983438106813499684e-03, 3.018515337397842391e-02], 
-[1.047615752789665122e-01, 8.023427854757562983e-03, 3.018647818875494146e-02], 
-[1.047615752789665122e-01, 9.218295280327699903e-03, 3.019240876775804508e-02], 
-[1.047615752789665122e-01, 1.059110512533918171e-02, 3.020367616356498322e-02], 
-[1.047615752789665122e-01, 1.216835698628199354e-02, 3.022113579225695068e-02], 
-[1.047615752789665122e-01, 1.398049684082008047e-02, 3.024579118914321602e-02], 
-[1.047615752789665122e-01, 1.606250475199945058e-02, 3.027882308763102034e-02], 
-[1.047615752789665122e-01, 1.845457009472566828e-02, 3.032162524033919782e-02], 
-[1.047615752789665122e-01, 2.120286733852943389e-02, 3.037584884311765598e-02], 
-[1.047615752789665122e-01, 2.436044736169515681e-02, 3.044345802071527635e-02], 
-[1.047615752789665122e-01, 2.798826150195019707e-02, 3.052679964948817881e-02], 
-[1.047615752789665122e-01, 3.215633811115024138e-02, 3.062869191780029365e-02], 
-[1.047615752789665122e-01, 3.694513432520856594e-02, 3.075253759039047949e-02], 
-[1.047615752789665122e-01, 4.244708914272822542e-02, 3.090247014442406431e-02], 
-[1.047615752789665122e-01, 4.876840779169493850e-02, 3.108354407630030403e-02], 
-[1.047615752789665122e-01, 5.603111182818285713e-02, 3.130198518899779403e-02], 
-[1.047615752789665122e-01, 6.437539454049952259e-02, 3.156552325837215511e-02], 
-[1.047615752789665122e-01, 7.396232712556144451e-02, 3.188383924951375403e-02], 
-[1.047615752789665122e-01, 8.497696787531199003e-02, 3.226917399826036148e-02], 
-[1.047615752789665122e-01, 9.763193439036874088e-02, 3.273716794144176934e-02], 
-[1.047615752789665122e-01, 1.121715077759858903e-01, 3.330803707316194046e-02], 
-[1.047615752789665122e-01, 1.288763480443681220e-01, 3.400824752599143630e-02], 
-[1.047615752789665122e-01, 1.480689117455977755e-01, 3.487294563619719456e-02], 
-[1.047615752789665122e-01, 1.701196764046864207e-01, 3.594956102327030723e-02], 
-[1.047615752789665122e-01, 1.954542919161802172e-01, 3.730328296963188184e-02], 
-[1.047615752789665122e-01, 2.245617969409859638e-01, 3.902562779246959712e-02], 
-[1.047615752789665122e-01, 2.580040589080049296e-01, 4.124830541737083134e-02], 
-[1.047615752789665122e-01, 2.964266198426381838e-01, 4.416659253432458909e-02], 
-[1.047615752789665122e-01, 3.405711573811430193e-01, 4.808071605452333280e-02], 
-[1.047615752789665122e-01, 3.912898015080607528e-01, 5.347371156035044676e-02], 
-[1.047615752789665122e-01, 4.495615833752782953e-01, 6.116958821596962803e-02], 
-[1.047615752789665122e-01, 5.165113337172515529e-01, 7.268844234129662185e-02], 
-[1.047615752789665122e-01, 5.934313956619206021e-01, 9.116020743865169140e-02], 
-[1.047615752789665122e-01, 6.818065710636164178e-01, 1.241922502277869600e-01], 
-[1.047615752789665122e-01, 7.833427819015473803e-01, 1.963192711729272455e-01], 
-[1.047615752789665122e-01, 9.000000000000000222e-01, 4.569078199210335756e-01], 
-[1.047615752789665122e-01, 9.020408163265306589e-01, 4.668490116534376178e-01], 
-[1.047615752789665122e-01, 9.040816326530612956e-01, 4.772029274312966085e-01], 
-[1.047615752789665122e-01, 9.061224489795918213e-01, 4.879959578538293763e-01], 
-[1.047615752789665122e-01, 9.081632653061224580e-01, 4.992568049325748492e-01], 
-[1.047615752789665122e-01, 9.102040816326530948e-01, 5.110167416479018954e-01], 
-[1.047615752789665122e-01, 9.122448979591837315e-01, 5.233099073628300069e-01], 
-[1.047615752789665122e-01, 9.142857142857142572e-01, 5.361736450189744652e-01], 
-[1.047615752789665122e-01, 9.163265306122448939e-01, 5.496488871866271886e-01], 
-[1.047615752789665122e-01, 9.183673469387755306e-01, 5.637805994447138147e-01], 
-[1.047615752789665122e-01, 9.204081632653061673e-01, 5.786182912915751597e-01], 
-[1.047615752789665122e-01, 9.224489795918368040e-01, 5.942166069186959332e-01], 
-[1.047615752789665122e-01, 9.244897959183673297e-01, 6.106360108254677010e-01], 
-[1.047615752789665122e-01, 9.265306122448979664e-01, 6.279435865558850027e-01], 
-[1.047615752789665122e-01, 9.285714285714286031e-01, 6.462139709842982249e-01], 
-[1.047615752789665122e-01, 9.306122448979592399e-01, 6.655304518136697656e-01], 
-[1.047615752789665122e-01, 9.326530612244897656e-01, 6.859862626038787381e-01], 
-[1.047615752789665122e-01, 9.346938775510204023e-01, 7.076861181603592010e-01], 
-[1.047615752789665122e-01, 9.367346938775510390e-01, 7.307480440801327193e-01], 
-[1.047615752789665122e-01, 9.387755102040816757e-01, 7.553055684858529517e-01], 
-[1.047615752789665122e-01, 9.408163265306123124e-01, 7.815103625980861501e-01], 
-[1.047615752789665122e-01, 9.428571428571428381e-01, 8.095354413580931885e-01], 
-[1.047615752789665122e-01, 9.448979591836734748e-01, 8.395790680042436449e-01], 
-[1.047615752789665122e-01, 9.469387755102041115e-01, 8.718695504310667310e-01], 
-[1.047615752789665122e-01, 9.489795918367347483e-01, 9.066711767848859571e-01], 
-[1.047615752789665122e-01, 9.510204081632652739e-01, 9.442916195726430706e-01], 
-[1.047615752789665122e-01, 9.530612244897959107e-01, 9.850912511667813121e-01], 
-[1.047615752789665122e-01, 9.551020408163265474e-01, 1.029494973329816876e+00], 
-[1.047615752789665122e-01, 9.571428571428571841e-01, 1.078007391077264954e+00], 
-[1.047615752789665122e-01, 9.591836734693878208e-01, 1.131232490592144924e+00], 
-[1.047615752789665122e-01, 9.612244897959183465e-01, 1.189899465156550651e+00], 
-[1.047615752789665122e-01, 9.632653061224489832e-01, 1.254897057609000610e+00], 
-[1.047615752789665122e-01, 9.653061224489796199e-01, 1.327319893025084019e+00], 
-[1.047615752789665122e-01, 9.673469387755102566e-01, 1.408531997365619848e+00], 
-[1.047615752789665122e-01, 9.693877551020407823e-01, 1.500255445014505806e+00], 
-[1.047615752789665122e-01, 9.714285714285714191e-01, 1.604696577319545181e+00], 
-[1.047615752789665122e-01, 9.734693877551020558e-01, 1.724729823132799655e+00], 
-[1.047615752789665122e-01, 9.755102040816326925e-01, 1.864172386148019500e+00], 
-[1.047615752789665122e-01, 9.775510204081632182e-01, 2.028207034551252619e+00], 
-[1.047615752789665122e-01, 9.795918367346938549e-01, 2.224055587785970900e+00], 
-[1.047615752789665122e-01, 9.816326530612244916e-01, 2.462096013837852482e+00], 
-[1.047615752789665122e-01, 9.836734693877551283e-01, 2.757807051764620709e+00], 
-[1.047615752789665122e-01, 9.857142857142857650e-01, 3.135358520985434438e+00], 
-[1.047615752789665122e-01, 9.877551020408162907e-01, 3.634744611182874952e+00], 
-[1.047615752789665122e-01, 9.897959183673469274e-01, 4.327358427981190303e+00], 
-[1.047615752789665122e-01, 9.918367346938775642e-01, 5.354581456484313939e+00], 
-[1.047615752789665122e-01, 9.938775510204082009e-01, 7.042286810749197379e+00], 
-[1.047615752789665122e-01, 9.959183673469387266e-01, 1.035225572258883986e+01], 
-[1.047615752789665122e-01, 9.979591836734693633e-01, 1.997104480519121950e+01], 
-[1.047615752789665122e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.149756995397736847e-01, 1.000000000000000021e-03, 3.067642536716685270e-02], 
-[1.149756995397736847e-01, 1.148922311909569708e-03, 3.065146966171754944e-02], 
-[1.149756995397736847e-01, 1.320022478803632065e-03, 3.062715113485020568e-02], 
-[1.149756995397736847e-01, 1.516603278119670137e-03, 3.060356503049358953e-02], 
-[1.149756995397736847e-01, 1.742459344546885402e-03, 3.058082100238022211e-02], 
-[1.149756995397736847e-01, 2.001950418545241171e-03, 3.055904534909377468e-02], 
-[1.149756995397736847e-01, 2.300085503203331758e-03, 3.053838361293662040e-02], 
-[1.149756995397736847e-01, 2.642619553930058204e-03, 3.051900360735826379e-02], 
-[1.149756995397736847e-01, 3.036164567398761706e-03, 3.050109895050425249e-02], 
-[1.149756995397736847e-01, 3.488317214113704091e-03, 3.048489319868715255e-02], 
-[1.149756995397736847e-01, 4.007805478313466660e-03, 3.047064469358320288e-02], 
-[1.149756995397736847e-01, 4.604657135827751671e-03, 3.045865226219329064e-02], 
-[1.149756995397736847e-01, 5.290393322046124149e-03, 3.044926193992215230e-02], 
-[1.149756995397736847e-01, 6.078250926476181683e-03, 3.044287492740400253e-02], 
-[1.149756995397736847e-01, 6.983438106813499684e-03, 3.043995704240033337e-02], 
-[1.149756995397736847e-01, 8.023427854757562983e-03, 3.044104999343295176e-02], 
-[1.149756995397736847e-01, 9.218295280327699903e-03, 3.044678488594625143e-02], 
-[1.149756995397736847e-01, 1.059110512533918171e-02, 3.045789848100689118e-02], 
-[1.149756995397736847e-01, 1.216835698628199354e-02, 3.047525286919888776e-02], 
-[1.149756995397736847e-01, 1.398049684082008047e-02, 3.049985941002907042e-02], 
-[1.149756995397736847e-01, 1.606250475199945058e-02, 3.053290803545594817e-02], 
-[1.149756995397736847e-01, 1.845457009472566828e-02, 3.057580334750050963e-02], 
-[1.149756995397736847e-01, 2.120286733852943389e-02, 3.063020938482650946e-02], 
-[1.149756995397736847e-01, 2.436044736169515681e-02, 3.069810553579564727e-02], 
-[1.149756995397736847e-01, 2.798826150195019707e-02, 3.078185689833808428e-02], 
-[1.149756995397736847e-01, 3.215633811115024138e-02, 3.088430352074297489e-02], 
-[1.149756995397736847e-01, 3.694513432520856594e-02, 3.100887453490079604e-02], 
-[1.149756995397736847e-01, 4.244708914272822542e-02, 3.115973541152918663e-02], 
-[1.149756995397736847e-01, 4.876840779169493850e-02, 3.134197972175882529e-02], 
-[1.149756995397736847e-01, 5.603111182818285713e-02, 3.156188133391041317e-02], 
-[1.149756995397736847e-01, 6.437539454049952259e-02, 3.182722961207730406e-02], 
-[1.149756995397736847e-01, 7.396232712556144451e-02, 3.214778002850447736e-02], 
-[1.149756995397736847e-01, 8.497696787531199003e-02, 3.253586745506001354e-02], 
-[1.149756995397736847e-01, 9.763193439036874088e-02, 3.300725223509411166e-02], 
-[1.149756995397736847e-01, 1.121715077759858903e-01, 3.358230499284285686e-02], 
-[1.149756995397736847e-01, 1.288763480443681220e-01, 3.428769377899177490e-02], 
-[1.149756995397736847e-01, 1.480689117455977755e-01, 3.515883230177969943e-02], 
-[1.149756995397736847e-01, 1.701196764046864207e-01, 3.624350983395953352e-02], 
-[1.149756995397736847e-01, 1.954542919161802172e-01, 3.760740819144813007e-02], 
-[1.149756995397736847e-01, 2.245617969409859638e-01, 3.934273231958337891e-02], 
-[1.149756995397736847e-01, 2.580040589080049296e-01, 4.158217865416383163e-02], 
-[1.149756995397736847e-01, 2.964266198426381838e-01, 4.452247887706976132e-02], 
-[1.149756995397736847e-01, 3.405711573811430193e-01, 4.846608353990332352e-02], 
-[1.149756995397736847e-01, 3.912898015080607528e-01, 5.389958130362143551e-02], 
-[1.149756995397736847e-01, 4.495615833752782953e-01, 6.165299406805108823e-02], 
-[1.149756995397736847e-01, 5.165113337172515529e-01, 7.325740502529641540e-02], 
-[1.149756995397736847e-01, 5.934313956619206021e-01, 9.186510880025514081e-02], 
-[1.149756995397736847e-01, 6.818065710636164178e-01, 1.251370223790819192e-01], 
-[1.149756995397736847e-01, 7.833427819015473803e-01, 1.977770369074526580e-01], 
-[1.149756995397736847e-01, 9.000000000000000222e-01, 4.601453844911130298e-01], 
-[1.149756995397736847e-01, 9.020408163265306589e-01, 4.701528929232943743e-01], 
-[1.149756995397736847e-01, 9.040816326530612956e-01, 4.805757811155454973e-01], 
-[1.149756995397736847e-01, 9.061224489795918213e-01, 4.914406053370702354e-01], 
-[1.149756995397736847e-01, 9.081632653061224580e-01, 5.027762475087211858e-01], 
-[1.149756995397736847e-01, 9.102040816326530948e-01, 5.146141763340779107e-01], 
-[1.149756995397736847e-01, 9.122448979591837315e-01, 5.269887445025274175e-01], 
-[1.149756995397736847e-01, 9.142857142857142572e-01, 5.399375279242359937e-01], 
-[1.149756995397736847e-01, 9.163265306122448939e-01, 5.535017141108096173e-01], 
-[1.149756995397736847e-01, 9.183673469387755306e-01, 5.677265482273894381e-01], 
-[1.149756995397736847e-01, 9.204081632653061673e-01, 5.826618470772032543e-01], 
-[1.149756995397736847e-01, 9.224489795918368040e-01, 5.983625934231937560e-01], 
-[1.149756995397736847e-01, 9.244897959183673297e-01, 6.148896257127030029e-01], 
-[1.149756995397736847e-01, 9.265306122448979664e-01, 6.323104415931743993e-01], 
-[1.149756995397736847e-01, 9.285714285714286031e-01, 6.507001377771095552e-01], 
-[1.149756995397736847e-01, 9.306122448979592399e-01, 6.701425140811024805e-01], 
-[1.149756995397736847e-01, 9.326530612244897656e-01, 6.907313761563098620e-01], 
-[1.149756995397736847e-01, 9.346938775510204023e-01, 7.125720799894734725e-01], 
-[1.149756995397736847e-01, 9.367346938775510390e-01, 7.357833722834357104e-01], 
-[1.149756995397736847e-01, 9.387755102040816757e-01, 7.604995951412797384e-01], 
-[1.149756995397736847e-01, 9.408163265306123124e-01, 7.868733422043669989e-01], 
-[1.149756995397736847e-01, 9.428571428571428381e-01, 8.150786780968110046e-01], 
-[1.149756995397736847e-01, 9.448979591836734748e-01, 8.453150659059338601e-01], 
-[1.149756995397736847e-01, 9.469387755102041115e-01, 8.778121916036392136e-01], 
-[1.149756995397736847e-01, 9.489795918367347483e-01, 9.128359342763292528e-01], 
-[1.149756995397736847e-01, 9.510204081632652739e-01, 9.506958133159152391e-01], 
-[1.149756995397736847e-01, 9.530612244897959107e-01, 9.917543579706905588e-01], 
-[1.149756995397736847e-01, 9.551020408163265474e-01, 1.036439005292776994e+00], 
-[1.149756995397736847e-01, 9.571428571428571841e-01, 1.085257361488754402e+00], 
-[1.149756995397736847e-01, 9.591836734693878208e-01, 1.138816992912916604e+00], 
-[1.149756995397736847e-01, 9.612244897959183465e-01, 1.197851399888194557e+00], 
-[1.149756995397736847e-01, 9.632653061224489832e-01, 1.263254555098340060e+00], 
-[1.149756995397736847e-01, 9.653061224489796199e-01, 1.336127499585611389e+00], 
-[1.149756995397736847e-01, 9.673469387755102566e-01, 1.417842220904626638e+00], 
-[1.149756995397736847e-01, 9.693877551020407823e-01, 1.510130800204543711e+00], 
-[1.149756995397736847e-01, 9.714285714285714191e-01, 1.615212338730267927e+00], 
-[1.149756995397736847e-01, 9.734693877551020558e-01, 1.735977804290366411e+00], 
-[1.149756995397736847e-01, 9.755102040816326925e-01, 1.876266243474015605e+00], 
-[1.149756995397736847e-01, 9.775510204081632182e-01, 2.041289904795679622e+00], 
-[1.149756995397736847e-01, 9.795918367346938549e-01, 2.238311419274247704e+00], 
-[1.149756995397736847e-01, 9.816326530612244916e-01, 2.477766982372424653e+00], 
-[1.149756995397736847e-01, 9.836734693877551283e-01, 2.775221487861422531e+00], 
-[1.149756995397736847e-01, 9.857142857142857650e-01, 3.154978078347171255e+00], 
-[1.149756995397736847e-01, 9.877551020408162907e-01, 3.657249293342267116e+00], 
-[1.149756995397736847e-01, 9.897959183673469274e-01, 4.353813344052190004e+00], 
-[1.149756995397736847e-01, 9.918367346938775642e-01, 5.386803366752800137e+00], 
-[1.149756995397736847e-01, 9.938775510204082009e-01, 7.083793612671581030e+00], 
-[1.149756995397736847e-01, 9.959183673469387266e-01, 1.041146272673038098e+01], 
-[1.149756995397736847e-01, 9.979591836734693633e-01, 2.007928447723340071e+01], 
-[1.149756995397736847e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.261856883066020951e-01, 1.000000000000000021e-03, 3.093679949779287730e-02], 
-[1.261856883066020951e-01, 1.148922311909569708e-03, 3.091140396140214242e-02], 
-[1.261856883066020951e-01, 1.320022478803632065e-03, 3.088665062720882121e-02], 
-[1.261856883066020951e-01, 1.516603278119670137e-03, 3.086263548523281164e-02], 
-[1.261856883066020951e-01, 1.742459344546885402e-03, 3.083946904747393580e-02], 
-[1.261856883066020951e-01, 2.001950418545241171e-03, 3.081727860025449545e-02], 
-[1.261856883066020951e-01, 2.300085503203331758e-03, 3.079621082319193570e-02], 
-[1.261856883066020951e-01, 2.642619553930058204e-03, 3.077643484002701851e-02], 
-[1.261856883066020951e-01, 3.036164567398761706e-03, 3.075814577946891365e-02], 
-[1.261856883066020951e-01, 3.488317214113704091e-03, 3.074156894057634287e-02], 
-[1.261856883066020951e-01, 4.007805478313466660e-03, 3.072696467735382825e-02], 
-[1.261856883066020951e-01, 4.604657135827751671e-03, 3.071463414265985722e-02], 
-[1.261856883066020951e-01, 5.290393322046124149e-03, 3.070492606309816255e-02], 
-[1.261856883066020951e-01, 6.078250926476181683e-03, 3.069824475712224637e-02], 
-[1.261856883066020951e-01, 6.983438106813499684e-03, 3.069505965968409925e-02], 
-[1.261856883066020951e-01, 8.023427854757562983e-03, 3.069591668258710160e-02], 
-[1.261856883066020951e-01, 9.218295280327699903e-03, 3.070145182447558616e-02], 
-[1.261856883066020951e-01, 1.059110512533918171e-02, 3.071240755443868653e-02], 
-[1.261856883066020951e-01, 1.216835698628199354e-02, 3.072965263694060062e-02], 
-[1.261856883066020951e-01, 1.398049684082008047e-02, 3.075420625486508658e-02], 
-[1.261856883066020951e-01, 1.606250475199945058e-02, 3.078726753764878324e-02], 
-[1.261856883066020951e-01, 1.845457009472566828e-02, 3.083025193531824248e-02], 
-[1.261856883066020951e-01, 2.120286733852943389e-02, 3.088483632753821068e-02], 
-[1.261856883066020951e-01, 2.436044736169515681e-02, 3.095301536393088582e-02], 
-[1.261856883066020951e-01, 2.798826150195019707e-02, 3.103717236094401255e-02], 
-[1.261856883066020951e-01, 3.215633811115024138e-02, 3.114016922280892635e-02], 
-[1.261856883066020951e-01, 3.694513432520856594e-02, 3.126546144335376476e-02], 
-[1.261856883066020951e-01, 4.244708914272822542e-02, 3.141724647998370146e-02], 
-[1.261856883066020951e-01, 4.876840779169493850e-02, 3.160065696945825453e-02], 
-[1.261856883066020951e-01, 5.603111182818285713e-02, 3.182201483327073976e-02], 
-[1.261856883066020951e-01, 6.437539454049952259e-02, 3.208916900733028293e-02], 
-[1.261856883066020951e-01, 7.396232712556144451e-02, 3.241194944864617122e-02], 
-[1.261856883066020951e-01, 8.497696787531199003e-02, 3.280278503424170766e-02], 
-[1.261856883066020951e-01, 9.763193439036874088e-02, 3.327755597088508793e-02], 
-[1.261856883066020951e-01, 1.121715077759858903e-01, 3.385678745196404188e-02], 
-[1.261856883066020951e-01, 1.288763480443681220e-01, 3.456734935874167247e-02], 
-[1.261856883066020951e-01, 1.480689117455977755e-01, 3.544492264375087576e-02], 
-[1.261856883066020951e-01, 1.701196764046864207e-01, 3.653765604346394247e-02], 
-[1.261856883066020951e-01, 1.954542919161802172e-01, 3.791172362026780374e-02], 
-[1.261856883066020951e-01, 2.245617969409859638e-01, 3.966001850302142140e-02], 
-[1.261856883066020951e-01, 2.580040589080049296e-01, 4.191622293048155590e-02], 
-[1.261856883066020951e-01, 2.964266198426381838e-01, 4.487852241538069220e-02], 
-[1.261856883066020951e-01, 3.405711573811430193e-01, 4.885158916906153642e-02], 
-[1.261856883066020951e-01, 3.912898015080607528e-01, 5.432556138567730397e-02], 
-[1.261856883066020951e-01, 4.495615833752782953e-01, 6.213646694842916984e-02], 
-[1.261856883066020951e-01, 5.165113337172515529e-01, 7.382636194773542493e-02], 
-[1.261856883066020951e-01, 5.934313956619206021e-01, 9.256986962377815320e-02], 
-[1.261856883066020951e-01, 6.818065710636164178e-01, 1.260813669430665418e-01], 
-[1.261856883066020951e-01, 7.833427819015473803e-01, 1.992335958181324362e-01], 
-[1.261856883066020951e-01, 9.000000000000000222e-01, 4.633779128820055826e-01], 
-[1.261856883066020951e-01, 9.020408163265306589e-01, 4.734515706598512730e-01], 
-[1.261856883066020951e-01, 9.040816326530612956e-01, 4.839432556741121161e-01], 
-[1.261856883066020951e-01, 9.061224489795918213e-01, 4.948796892843247974e-01], 
-[1.261856883066020951e-01, 9.081632653061224580e-01, 5.062899326868655070e-01], 
-[1.261856883066020951e-01, 9.102040816326530948e-01, 5.182056496142191104e-01], 
-[1.261856883066020951e-01, 9.122448979591837315e-01, 5.306614053200277015e-01], 
-[1.261856883066020951e-01, 9.142857142857142572e-01, 5.436950078447246870e-01], 
-[1.261856883066020951e-01, 9.163265306122448939e-01, 5.573478987171553989e-01], 
-[1.261856883066020951e-01, 9.183673469387755306e-01, 5.716656016677039709e-01], 
-[1.261856883066020951e-01, 9.204081632653061673e-01, 5.866982396737578931e-01], 
-[1.261856883066020951e-01, 9.224489795918368040e-01, 6.025011328142897415e-01], 
-[1.261856883066020951e-01, 9.244897959183673297e-01, 6.191354920870260070e-01], 
-[1.261856883066020951e-01, 9.265306122448979664e-01, 6.366692276827419228e-01], 
-[1.261856883066020951e-01, 9.285714285714286031e-01, 6.551778944054060805e-01], 
-[1.261856883066020951e-01, 9.306122448979592399e-01, 6.747458022236376696e-01], 
-[1.261856883066020951e-01, 9.326530612244897656e-01, 6.954673266696863587e-01], 
-[1.261856883066020951e-01, 9.346938775510204023e-01, 7.174484624127165366e-01], 
-[1.261856883066020951e-01, 9.367346938775510390e-01, 7.408086744257162959e-01], 
-[1.261856883066020951e-01, 9.387755102040816757e-01, 7.656831155617788154e-01], 
-[1.261856883066020951e-01, 9.408163265306123124e-01, 7.922252981876527489e-01], 
-[1.261856883066020951e-01, 9.428571428571428381e-01, 8.206103323642304215e-01], 
-[1.261856883066020951e-01, 9.448979591836734748e-01, 8.510388761258642631e-01], 
-[1.261856883066020951e-01, 9.469387755102041115e-01, 8.837419878340029289e-01], 
-[1.261856883066020951e-01, 9.489795918367347483e-01, 9.189871308793685634e-01], 
-[1.261856883066020951e-01, 9.510204081632652739e-01, 9.570856637516403920e-01], 
-[1.261856883066020951e-01, 9.530612244897959107e-01, 9.984022633784577216e-01], 
-[1.261856883066020951e-01, 9.551020408163265474e-01, 1.043366891165890209e+00], 
-[1.261856883066020951e-01, 9.571428571428571841e-01, 1.092490141410478621e+00], 
-[1.261856883066020951e-01, 9.591836734693878208e-01, 1.146383144814109301e+00], 
-[1.261856883066020951e-01, 9.612244897959183465e-01, 1.205783689457188501e+00], 
-[1.261856883066020951e-01, 9.632653061224489832e-01, 1.271590954137316931e+00], 
-[1.261856883066020951e-01, 9.653061224489796199e-01, 1.344912366339021226e+00], 
-[1.261856883066020951e-01, 9.673469387755102566e-01, 1.427127838032785645e+00], 
-[1.261856883066020951e-01, 9.693877551020407823e-01, 1.519979409680553228e+00], 
-[1.261856883066020951e-01, 9.714285714285714191e-01, 1.625698880928697854e+00], 
-[1.261856883066020951e-01, 9.734693877551020558e-01, 1.747193677458283467e+00], 
-[1.261856883066020951e-01, 9.755102040816326925e-01, 1.888324579705007888e+00], 
-[1.261856883066020951e-01, 9.775510204081632182e-01, 2.054333166456677073e+00], 
-[1.261856883066020951e-01, 9.795918367346938549e-01, 2.252522668217979529e+00], 
-[1.261856883066020951e-01, 9.816326530612244916e-01, 2.493387198469076527e+00], 
-[1.261856883066020951e-01, 9.836734693877551283e-01, 2.792577336487587658e+00], 
-[1.261856883066020951e-01, 9.857142857142857650e-01, 3.174528802183163467e+00], 
-[1.261856883066020951e-01, 9.877551020408162907e-01, 3.679671226115770466e+00], 
-[1.261856883066020951e-01, 9.897959183673469274e-01, 4.380165627939358153e+00], 
-[1.261856883066020951e-01, 9.918367346938775642e-01, 5.418892129763291265e+00], 
-[1.261856883066020951e-01, 9.938775510204082009e-01, 7.125115040329308869e+00], 
-[1.261856883066020951e-01, 9.959183673469387266e-01, 1.047037646209663464e+01], 
-[1.261856883066020951e-01, 9.979591836734693633e-01, 2.018689255264763105e+01], 
-[1.261856883066020951e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.384886371393873050e-01, 1.000000000000000021e-03, 3.119752983221524972e-02], 
-[1.384886371393873050e-01, 1.148922311909569708e-03, 3.117169037893492353e-02], 
-[1.384886371393873050e-01, 1.320022478803632065e-03, 3.114649815235346134e-02], 
-[1.384886371393873050e-01, 1.516603278119670137e-03, 3.112204988864246402e-02], 
-[1.384886371393873050e-01, 1.742459344546885402e-03, 3.109845695812816710e-02], 
-[1.384886371393873050e-01, 2.001950418545241171e-03, 3.107584763492777374e-02], 
-[1.384886371393873050e-01, 2.300085503203331758e-03, 3.105436973602468398e-02], 
-[1.384886371393873050e-01, 2.642619553930058204e-03, 3.103419369549394874e-02], 
-[1.384886371393873050e-01, 3.036164567398761706e-03, 3.101551615263993880e-02], 
-[1.384886371393873050e-01, 3.488317214113704091e-03, 3.099856414928326559e-02], 
-[1.384886371393873050e-01, 4.007805478313466660e-03, 3.098360005175124915e-02], 
-[1.384886371393873050e-01, 4.604657135827751671e-03, 3.097092733872649356e-02], 
-[1.384886371393873050e-01, 5.290393322046124149e-03, 3.096089742794171790e-02], 
-[1.384886371393873050e-01, 6.078250926476181683e-03, 3.095391775555256242e-02], 
-[1.384886371393873050e-01, 6.983438106813499684e-03, 3.095046137352414767e-02], 
-[1.384886371393873050e-01, 8.023427854757562983e-03, 3.095107839668718996e-02], 
-[1.384886371393873050e-01, 9.218295280327699903e-03, 3.095640971653911000e-02], 
-[1.384886371393873050e-01, 1.059110512533918171e-02, 3.096720350970123131e-02], 
-[1.384886371393873050e-01, 1.216835698628199354e-02, 3.098433521389997586e-02], 
-[1.384886371393873050e-01, 1.398049684082008047e-02, 3.100883183455884623e-02], 
-[1.384886371393873050e-01, 1.606250475199945058e-02, 3.104190169750584150e-02], 
-[1.384886371393873050e-01, 1.845457009472566828e-02, 3.108497109936058517e-02], 
-[1.384886371393873050e-01, 2.120286733852943389e-02, 3.113972975895716588e-02], 
-[1.384886371393873050e-01, 2.436044736169515681e-02, 3.120818758480385646e-02], 
-[1.384886371393873050e-01, 2.798826150195019707e-02, 3.129274610878345075e-02], 
-[1.384886371393873050e-01, 3.215633811115024138e-02, 3.139628908705527355e-02], 
-[1.384886371393873050e-01, 3.694513432520856594e-02, 3.152229837013417746e-02], 
-[1.384886371393873050e-01, 4.244708914272822542e-02, 3.167500339520358532e-02], 
-[1.384886371393873050e-01, 4.876840779169493850e-02, 3.185957585549657745e-02], 
-[1.384886371393873050e-01, 5.603111182818285713e-02, 3.208238571344191464e-02], 
-[1.384886371393873050e-01, 6.437539454049952259e-02, 3.235134146026601154e-02], 
-[1.384886371393873050e-01, 7.396232712556144451e-02, 3.267634751525395898e-02], 
-[1.384886371393873050e-01, 8.497696787531199003e-02, 3.306992672958884716e-02], 
-[1.384886371393873050e-01, 9.763193439036874088e-02, 3.354807913020497329e-02], 
-[1.384886371393873050e-01, 1.121715077759858903e-01, 3.413148441847345393e-02], 
-[1.384886371393873050e-01, 1.288763480443681220e-01, 3.484721421846003614e-02], 
-[1.384886371393873050e-01, 1.480689117455977755e-01, 3.573121659901117020e-02], 
-[1.384886371393873050e-01, 1.701196764046864207e-01, 3.683199957038667260e-02], 
-[1.384886371393873050e-01, 1.954542919161802172e-01, 3.821622915391265779e-02], 
-[1.384886371393873050e-01, 2.245617969409859638e-01, 3.997748621667938929e-02], 
-[1.384886371393873050e-01, 2.580040589080049296e-01, 4.225043809227932434e-02], 
-[1.384886371393873050e-01, 2.964266198426381838e-01, 4.523472296211182575e-02], 
-[1.384886371393873050e-01, 3.405711573811430193e-01, 4.923723271509151955e-02], 
-[1.384886371393873050e-01, 3.912898015080607528e-01, 5.475165153129660234e-02], 
-[1.384886371393873050e-01, 4.495615833752782953e-01, 6.262000652289104186e-02], 
-[1.384886371393873050e-01, 5.165113337172515529e-01, 7.439531270346209924e-02], 
-[1.384886371393873050e-01, 5.934313956619206021e-01, 9.327448942589486314e-02], 
-[1.384886371393873050e-01, 6.818065710636164178e-01, 1.270252833879338128e-01], 
-[1.384886371393873050e-01, 7.833427819015473803e-01, 2.006889476042444387e-01], 
-[1.384886371393873050e-01, 9.000000000000000222e-01, 4.666054084878454855e-01], 
-[1.384886371393873050e-01, 9.020408163265306589e-01, 4.767450484699807256e-01], 
-[1.384886371393873050e-01, 9.040816326530612956e-01, 4.873053549403016382e-01], 
-[1.384886371393873050e-01, 9.061224489795918213e-01, 4.983132137701455355e-01], 
-[1.384886371393873050e-01, 9.081632653061224580e-01, 5.097978647988586909e-01], 
-[1.384886371393873050e-01, 9.102040816326530948e-01, 5.217911660948919561e-01], 
-[1.384886371393873050e-01, 9.122448979591837315e-01, 5.343278947155440939e-01], 
-[1.384886371393873050e-01, 9.142857142857142572e-01, 5.474460899949138426e-01], 
-[1.384886371393873050e-01, 9.163265306122448939e-01, 5.611874465568796877e-01], 
-[1.384886371393873050e-01, 9.183673469387755306e-01, 5.755977656781852136e-01], 
-[1.384886371393873050e-01, 9.204081632653061673e-01, 5.907274753819827806e-01], 
-[1.384886371393873050e-01, 9.224489795918368040e-01, 6.066322318104624411e-01], 
-[1.384886371393873050e-01, 9.244897959183673297e-01, 6.233736171171125884e-01], 
-[1.384886371393873050e-01, 9.265306122448979664e-01, 6.410199524792402626e-01], 
-[1.384886371393873050e-01, 9.285714285714286031e-01, 6.596472490493519025e-01], 
-[1.384886371393873050e-01, 9.306122448979592399e-01, 6.793403249907417063e-01], 
-[1.384886371393873050e-01, 9.326530612244897656e-01, 7.001941235114190754e-01], 
-[1.384886371393873050e-01, 9.346938775510204023e-01, 7.223152754696294808e-01], 
-[1.384886371393873050e-01, 9.367346938775510390e-01, 7.458239612791912609e-01], 
-[1.384886371393873050e-01, 9.387755102040816757e-01, 7.708561413201158175e-01], 
-[1.384886371393873050e-01, 9.408163265306123124e-01, 7.975662429976071444e-01], 
-[1.384886371393873050e-01, 9.428571428571428381e-01, 8.261304175731137844e-01], 
-[1.384886371393873050e-01, 9.448979591836734748e-01, 8.567505131376252914e-01], 
-[1.384886371393873050e-01, 9.469387755102041115e-01, 8.896589547678145360e-01], 
-[1.384886371393873050e-01, 9.489795918367347483e-01, 9.251247835389423413e-01], 
-[1.384886371393873050e-01, 9.510204081632652739e-01, 9.634611892702423797e-01], 
-[1.384886371393873050e-01, 9.530612244897959107e-01, 1.005034987394912260e+00], 
-[1.384886371393873050e-01, 9.551020408163265474e-01, 1.050278652764690346e+00], 
-[1.384886371393873050e-01, 9.571428571428571841e-01, 1.099705754698231397e+00], 
-[1.384886371393873050e-01, 9.591836734693878208e-01, 1.153930972462072324e+00], 
-[1.384886371393873050e-01, 9.612244897959183465e-01, 1.213696362661118577e+00], 
-[1.384886371393873050e-01, 9.632653061224489832e-01, 1.279906286538382121e+00], 
-[1.384886371393873050e-01, 9.653061224489796199e-01, 1.353674528575815383e+00], 
-[1.384886371393873050e-01, 9.673469387755102566e-01, 1.436388888083663495e+00], 
-[1.384886371393873050e-01, 9.693877551020407823e-01, 1.529801317516370496e+00], 
-[1.384886371393873050e-01, 9.714285714285714191e-01, 1.636156253600514532e+00], 
-[1.384886371393873050e-01, 9.734693877551020558e-01, 1.758377499039879499e+00], 
-[1.384886371393873050e-01, 9.755102040816326925e-01, 1.900347459388992855e+00], 
-[1.384886371393873050e-01, 9.775510204081632182e-01, 2.067336894105133549e+00], 
-[1.384886371393873050e-01, 9.795918367346938549e-01, 2.266689421741049593e+00], 
-[1.384886371393873050e-01, 9.816326530612244916e-01, 2.508956765308449910e+00], 
-[1.384886371393873050e-01, 9.836734693877551283e-01, 2.809874721898301342e+00], 
-[1.384886371393873050e-01, 9.857142857142857650e-01, 3.194010845314659619e+00], 
-[1.384886371393873050e-01, 9.877551020408162907e-01, 3.702010602685072538e+00], 
-[1.384886371393873050e-01, 9.897959183673469274e-01, 4.406415533101833759e+00], 
-[1.384886371393873050e-01, 9.918367346938775642e-01, 5.450848096319188762e+00], 
-[1.384886371393873050e-01, 9.938775510204082009e-01, 7.166251621591682941e+00], 
-[1.384886371393873050e-01, 9.959183673469387266e-01, 1.052899785196316351e+01], 
-[1.384886371393873050e-01, 9.979591836734693633e-01, 2.029387134651634028e+01], 
-[1.384886371393873050e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.519911082952934700e-01, 1.000000000000000021e-03, 3.145861661617208732e-02], 
-[1.519911082952934700e-01, 1.148922311909569708e-03, 3.143232915315634368e-02], 
-[1.519911082952934700e-01, 1.320022478803632065e-03, 3.140669394221839300e-02], 
-[1.519911082952934700e-01, 1.516603278119670137e-03, 3.138180846574088745e-02], 
-[1.519911082952934700e-01, 1.742459344546885402e-03, 3.135778495243415204e-02], 
-[1.519911082952934700e-01, 2.001950418545241171e-03, 3.133475266426496986e-02], 
-[1.519911082952934700e-01, 2.300085503203331758e-03, 3.131286055563180931e-02], 
-[1.519911082952934700e-01, 2.642619553930058204e-03, 3.129228037098491511e-02], 
-[1.519911082952934700e-01, 3.036164567398761706e-03, 3.127321026025302320e-02], 
-[1.519911082952934700e-01, 3.488317214113704091e-03, 3.125587900803171448e-02], 
-[1.519911082952934700e-01, 4.007805478313466660e-03, 3.124055099296231541e-02], 
-[1.519911082952934700e-01, 4.604657135827751671e-03, 3.122753201951453811e-02], 
-[1.519911082952934700e-01, 5.290393322046124149e-03, 3.121717619647583139e-02], 
-[1.519911082952934700e-01, 6.078250926476181683e-03, 3.120989407758204340e-02], 
-[1.519911082952934700e-01, 6.983438106813499684e-03, 3.120616233162846337e-02], 
-[1.519911082952934700e-01, 8.023427854757562983e-03, 3.120653527621252560e-02], 
-[1.519911082952934700e-01, 9.218295280327699903e-03, 3.121165869532024906e-02], 
-[1.519911082952934700e-01, 1.059110512533918171e-02, 3.122228647263678575e-02], 
-[1.519911082952934700e-01, 1.216835698628199354e-02, 3.123930071849227025e-02], 
-[1.519911082952934700e-01, 1.398049684082008047e-02, 3.126373626001133221e-02], 
-[1.519911082952934700e-01, 1.606250475199945058e-02, 3.129681061831289524e-02], 
-[1.519911082952934700e-01, 1.845457009472566828e-02, 3.133996093518120335e-02], 
-[1.519911082952934700e-01, 2.120286733852943389e-02, 3.139488976676935161e-02], 
-[1.519911082952934700e-01, 2.436044736169515681e-02, 3.146362227807517759e-02], 
-[1.519911082952934700e-01, 2.798826150195019707e-02, 3.154857821330783740e-02], 
-[1.519911082952934700e-01, 3.215633811115024138e-02, 3.165266317650944350e-02], 
-[1.519911082952934700e-01, 3.694513432520856594e-02, 3.177938536959355048e-02], 
-[1.519911082952934700e-01, 4.244708914272822542e-02, 3.193300620256812189e-02], 
-[1.519911082952934700e-01, 4.876840779169493850e-02, 3.211873641592909168e-02], 
-[1.519911082952934700e-01, 5.603111182818285713e-02, 3.234299400074414077e-02], 
-[1.519911082952934700e-01, 6.437539454049952259e-02, 3.261374698697371011e-02], 
-[1.519911082952934700e-01, 7.396232712556144451e-02, 3.294097423359486354e-02], 
-[1.519911082952934700e-01, 8.497696787531199003e-02, 3.333729253483498634e-02], 
-[1.519911082952934700e-01, 9.763193439036874088e-02, 3.381882169439299340e-02], 
-[1.519911082952934700e-01, 1.121715077759858903e-01, 3.440639586026749547e-02], 
-[1.519911082952934700e-01, 1.288763480443681220e-01, 3.512728831131502194e-02], 
-[1.519911082952934700e-01, 1.480689117455977755e-01, 3.601771410441252652e-02], 
-[1.519911082952934700e-01, 1.701196764046864207e-01, 3.712654033328668945e-02], 
-[1.519911082952934700e-01, 1.954542919161802172e-01, 3.852092469016756004e-02], 
-[1.519911082952934700e-01, 2.245617969409859638e-01, 4.029513533442730111e-02], 
-[1.519911082952934700e-01, 2.580040589080049296e-01, 4.258482398550408887e-02], 
-[1.519911082952934700e-01, 2.964266198426381838e-01, 4.559108033013503647e-02], 
-[1.519911082952934700e-01, 3.405711573811430193e-01, 4.962301395114317171e-02], 
-[1.519911082952934700e-01, 3.912898015080607528e-01, 5.517785146537378116e-02], 
-[1.519911082952934700e-01, 4.495615833752782953e-01, 6.310361245743306702e-02], 
-[1.519911082952934700e-01, 5.165113337172515529e-01, 7.496425688768564022e-02], 
-[1.519911082952934700e-01, 5.934313956619206021e-01, 9.397896772390043618e-02], 
-[1.519911082952934700e-01, 6.818065710636164178e-01, 1.279687711829774477e-01], 
-[1.519911082952934700e-01, 7.833427819015473803e-01, 2.021430919671226845e-01], 
-[1.519911082952934700e-01, 9.000000000000000222e-01, 4.698278747055285587e-01], 
-[1.519911082952934700e-01, 9.020408163265306589e-01, 4.800333299632420503e-01], 
-[1.519911082952934700e-01, 9.040816326530612956e-01, 4.906620827500196569e-01], 
-[1.519911082952934700e-01, 9.061224489795918213e-01, 5.017411828715866440e-01], 
-[1.519911082952934700e-01, 9.081632653061224580e-01, 5.133000481789395941e-01], 
-[1.519911082952934700e-01, 9.102040816326530948e-01, 5.253707303849221022e-01], 
-[1.519911082952934700e-01, 9.122448979591837315e-01, 5.379882175914030285e-01], 
-[1.519911082952934700e-01, 9.142857142857142572e-01, 5.511907795912223129e-01], 
-[1.519911082952934700e-01, 9.163265306122448939e-01, 5.650203631829562312e-01], 
-[1.519911082952934700e-01, 9.183673469387755306e-01, 5.795230461729056204e-01], 
-[1.519911082952934700e-01, 9.204081632653061673e-01, 5.947495605039251343e-01], 
-[1.519911082952934700e-01, 9.224489795918368040e-01, 6.107558971312226914e-01], 
-[1.519911082952934700e-01, 9.244897959183673297e-01, 6.276040079723650411e-01], 
-[1.519911082952934700e-01, 9.265306122448979664e-01, 6.453626236377034697e-01], 
-[1.519911082952934700e-01, 9.285714285714286031e-01, 6.641082098890997987e-01], 
-[1.519911082952934700e-01, 9.306122448979592399e-01, 6.839260911314291036e-01], 
-[1.519911082952934700e-01, 9.326530612244897656e-01, 7.049117760479683970e-01], 
-[1.519911082952934700e-01, 9.346938775510204023e-01, 7.271725291982387152e-01], 
-[1.519911082952934700e-01, 9.367346938775510390e-01, 7.508292436139231141e-01], 
-[1.519911082952934700e-01, 9.387755102040816757e-01, 7.760186839861744623e-01], 
-[1.519911082952934700e-01, 9.408163265306123124e-01, 8.028961890801873391e-01], 
-[1.519911082952934700e-01, 9.428571428571428381e-01, 8.316389471315932536e-01], 
-[1.519911082952934700e-01, 9.448979591836734748e-01, 8.624499914090875130e-01], 
-[1.519911082952934700e-01, 9.469387755102041115e-01, 8.955631080437811420e-01], 
-[1.519911082952934700e-01, 9.489795918367347483e-01, 9.312489091916289485e-01], 
-[1.519911082952934700e-01, 9.510204081632652739e-01, 9.698224082521600398e-01], 
-[1.519911082952934700e-01, 9.530612244897959107e-01, 1.011652550013020235e+00], 
-[1.519911082952934700e-01, 9.551020408163265474e-01, 1.057174311890669349e+00], 
-[1.519911082952934700e-01, 9.571428571428571841e-01, 1.106904225191223334e+00], 
-[1.519911082952934700e-01, 9.591836734693878208e-01, 1.161460502003595074e+00], 
-[1.519911082952934700e-01, 9.612244897959183465e-01, 1.221589448274501333e+00], 
-[1.519911082952934700e-01, 9.632653061224489832e-01, 1.288200584086759415e+00], 
-[1.519911082952934700e-01, 9.653061224489796199e-01, 1.362414021554305021e+00], 
-[1.519911082952934700e-01, 9.673469387755102566e-01, 1.445625410352661566e+00], 
-[1.519911082952934700e-01, 9.693877551020407823e-01, 1.539596567740409316e+00], 
-[1.519911082952934700e-01, 9.714285714285714191e-01, 1.646584506377069879e+00], 
-[1.519911082952934700e-01, 9.734693877551020558e-01, 1.769529325373115691e+00], 
-[1.519911082952934700e-01, 9.755102040816326925e-01, 1.912334946994693086e+00], 
-[1.519911082952934700e-01, 9.775510204081632182e-01, 2.080301162214885480e+00], 
-[1.519911082952934700e-01, 9.795918367346938549e-01, 2.280811766847111066e+00], 
-[1.519911082952934700e-01, 9.816326530612244916e-01, 2.524475785920079041e+00], 
-[1.519911082952934700e-01, 9.836734693877551283e-01, 2.827113768155298246e+00], 
-[1.519911082952934700e-01, 9.857142857142857650e-01, 3.213424360309325323e+00], 
-[1.519911082952934700e-01, 9.877551020408162907e-01, 3.724267615888981364e+00], 
-[1.519911082952934700e-01, 9.897959183673469274e-01, 4.432563312515019227e+00], 
-[1.519911082952934700e-01, 9.918367346938775642e-01, 5.482671616498313583e+00], 
-[1.519911082952934700e-01, 9.938775510204082009e-01, 7.207203883129804645e+00], 
-[1.519911082952934700e-01, 9.959183673469387266e-01, 1.058732781725345262e+01], 
-[1.519911082952934700e-01, 9.979591836734693633e-01, 2.040022316695116089e+01], 
-[1.519911082952934700e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.668100537200059019e-01, 1.000000000000000021e-03, 3.172006009547227723e-02], 
-[1.668100537200059019e-01, 1.148922311909569708e-03, 3.169332052297352958e-02], 
-[1.668100537200059019e-01, 1.320022478803632065e-03, 3.166723822880043032e-02], 
-[1.668100537200059019e-01, 1.516603278119670137e-03, 3.164191144160479613e-02], 
-[1.668100537200059019e-01, 1.742459344546885402e-03, 3.161745324853745820e-02], 
-[1.668100537200059019e-01, 2.001950418545241171e-03, 3.159399389946770248e-02], 
-[1.668100537200059019e-01, 2.300085503203331758e-03, 3.157168348625646187e-02], 
-[1.668100537200059019e-01, 2.642619553930058204e-03, 3.155069506376791122e-02], 
-[1.668100537200059019e-01, 3.036164567398761706e-03, 3.153122829258192539e-02], 
-[1.668100537200059019e-01, 3.488317214113704091e-03, 3.151351370007936248e-02], 
-[1.668100537200059019e-01, 4.007805478313466660e-03, 3.149781767720372799e-02], 
-[1.668100537200059019e-01, 4.604657135827751671e-03, 3.148444835417106569e-02], 
-[1.668100537200059019e-01, 5.290393322046124149e-03, 3.147376253074516544e-02], 
-[1.668100537200059019e-01, 6.078250926476181683e-03, 3.146617387811534439e-02], 
-[1.668100537200059019e-01, 6.983438106813499684e-03, 3.146216268171852376e-02], 
-[1.668100537200059019e-01, 8.023427854757562983e-03, 3.146228746165183332e-02], 
-[1.668100537200059019e-01, 9.218295280327699903e-03, 3.146719889402328774e-02], 
-[1.668100537200059019e-01, 1.059110512533918171e-02, 3.147765656908895621e-02], 
-[1.668100537200059019e-01, 1.216835698628199354e-02, 3.149454926913012459e-02], 
-[1.668100537200059019e-01, 1.398049684082008047e-02, 3.151891964211687297e-02], 
-[1.668100537200059019e-01, 1.606250475199945058e-02, 3.155199440334508637e-02], 
-[1.668100537200059019e-01, 1.845457009472566828e-02, 3.159522153831927083e-02], 
-[1.668100537200059019e-01, 2.120286733852943389e-02, 3.165031643864235633e-02], 
-[1.668100537200059019e-01, 2.436044736169515681e-02, 3.171931952338326310e-02], 
-[1.668100537200059019e-01, 2.798826150195019707e-02, 3.180466874594263527e-02], 
-[1.668100537200059019e-01, 3.215633811115024138e-02, 3.190929155416922375e-02], 
-[1.668100537200059019e-01, 3.694513432520856594e-02, 3.203672249605017675e-02], 
-[1.668100537200059019e-01, 4.244708914272822542e-02, 3.219125494741992971e-02], 
-[1.668100537200059019e-01, 4.876840779169493850e-02, 3.237813868677399259e-02], 
-[1.668100537200059019e-01, 5.603111182818285713e-02, 3.260383972145466241e-02], 
-[1.668100537200059019e-01, 6.437539454049952259e-02, 3.287638560349692013e-02], 
-[1.668100537200059019e-01, 7.396232712556144451e-02, 3.320582960888787682e-02], 
-[1.668100537200059019e-01, 8.497696787531199003e-02, 3.360488244366374722e-02], 
-[1.668100537200059019e-01, 9.763193439036874088e-02, 3.408978364473713718e-02], 
-[1.668100537200059019e-01, 1.121715077759858903e-01, 3.468152174519106845e-02], 
-[1.668100537200059019e-01, 1.288763480443681220e-01, 3.540757159042395852e-02], 
-[1.668100537200059019e-01, 1.480689117455977755e-01, 3.630441509675839951e-02], 
-[1.668100537200059019e-01, 1.701196764046864207e-01, 3.742127825067885494e-02], 
-[1.668100537200059019e-01, 1.954542919161802172e-01, 3.882581012678038707e-02], 
-[1.668100537200059019e-01, 2.245617969409859638e-01, 4.061296573010958477e-02], 
-[1.668100537200059019e-01, 2.580040589080049296e-01, 4.291938045609430818e-02], 
-[1.668100537200059019e-01, 2.964266198426381838e-01, 4.594759433233955997e-02], 
-[1.668100537200059019e-01, 3.405711573811430193e-01, 5.000893265042272162e-02], 
-[1.668100537200059019e-01, 3.912898015080607528e-01, 5.560416091291907337e-02], 
-[1.668100537200059019e-01, 4.495615833752782953e-01, 6.358728441826058675e-02], 
-[1.668100537200059019e-01, 5.165113337172515529e-01, 7.553319409597583634e-02], 
-[1.668100537200059019e-01, 5.934313956619206021e-01, 9.468330403571018072e-02], 
-[1.668100537200059019e-01, 6.818065710636164178e-01, 1.289118297985903938e-01], 
-[1.668100537200059019e-01, 7.833427819015473803e-01, 2.035960286101544392e-01], 
-[1.668100537200059019e-01, 9.000000000000000222e-01, 4.730453149346979247e-01], 
-[1.668100537200059019e-01, 9.020408163265306589e-01, 4.833164187518658172e-01], 
-[1.668100537200059019e-01, 9.040816326530612956e-01, 4.940134429417556983e-01], 
-[1.668100537200059019e-01, 9.061224489795918213e-01, 5.051636006681858859e-01], 
-[1.668100537200059019e-01, 9.081632653061224580e-01, 5.167964871637172886e-01], 
-[1.668100537200059019e-01, 9.102040816326530948e-01, 5.289443470953758553e-01], 
-[1.668100537200059019e-01, 9.122448979591837315e-01, 5.416423788520239313e-01], 
-[1.668100537200059019e-01, 9.142857142857142572e-01, 5.549290818519961865e-01], 
-[1.668100537200059019e-01, 9.163265306122448939e-01, 5.688466541500959428e-01], 
-[1.668100537200059019e-01, 9.183673469387755306e-01, 5.834414490674622034e-01], 
-[1.668100537200059019e-01, 9.204081632653061673e-01, 5.987645013429155894e-01], 
-[1.668100537200059019e-01, 9.224489795918368040e-01, 6.148721354970929642e-01], 
-[1.668100537200059019e-01, 9.244897959183673297e-01, 6.318266718228897627e-01], 
-[1.668100537200059019e-01, 9.265306122448979664e-01, 6.496972488135228652e-01], 
-[1.668100537200059019e-01, 9.285714285714286031e-01, 6.685607851047703498e-01], 
-[1.668100537200059019e-01, 9.306122448979592399e-01, 6.885031093942388658e-01], 
-[1.668100537200059019e-01, 9.326530612244897656e-01, 7.096202936448199328e-01], 
-[1.668100537200059019e-01, 9.346938775510204023e-01, 7.320202336350298822e-01], 
-[1.668100537200059019e-01, 9.367346938775510390e-01, 7.558245321977932196e-01], 
-[1.668100537200059019e-01, 9.387755102040816757e-01, 7.811707551269319039e-01], 
-[1.668100537200059019e-01, 9.408163265306123124e-01, 8.082151488776170289e-01], 
-[1.668100537200059019e-01, 9.428571428571428381e-01, 8.371359344431092975e-01], 
-[1.668100537200059019e-01, 9.448979591836734748e-01, 8.681373254023734276e-01], 
-[1.668100537200059019e-01, 9.469387755102041115e-01, 9.014544632936317692e-01], 
-[1.668100537200059019e-01, 9.489795918367347483e-01, 9.373595247656175689e-01], 
-[1.668100537200059019e-01, 9.510204081632652739e-01, 9.761693390678169990e-01], 
-[1.668100537200059019e-01, 9.530612244897959107e-01, 1.018254971213855331e+00], 
-[1.668100537200059019e-01, 9.551020408163265474e-01, 1.064053890331246199e+00], 
-[1.668100537200059019e-01, 9.571428571428571841e-01, 1.114085576712052328e+00], 
-[1.668100537200059019e-01, 9.591836734693878208e-01, 1.168971759565879065e+00], 
-[1.668100537200059019e-01, 9.612244897959183465e-01, 1.229462975048758899e+00], 
-[1.668100537200059019e-01, 9.632653061224489832e-01, 1.296473878540420621e+00], 
-[1.668100537200059019e-01, 9.653061224489796199e-01, 1.371130880500586624e+00], 
-[1.668100537200059019e-01, 9.673469387755102566e-01, 1.454837444096994226e+00], 
-[1.668100537200059019e-01, 9.693877551020407823e-01, 1.549365204335648061e+00], 
-[1.668100537200059019e-01, 9.714285714285714191e-01, 1.656983688835414359e+00], 
-[1.668100537200059019e-01, 9.734693877551020558e-01, 1.780649212730583075e+00], 
-[1.668100537200059019e-01, 9.755102040816326925e-01, 1.924287106911565459e+00], 
-[1.668100537200059019e-01, 9.775510204081632182e-01, 2.093226045162744242e+00], 
-[1.668100537200059019e-01, 9.795918367346938549e-01, 2.294889790419659459e+00], 
-[1.668100537200059019e-01, 9.816326530612244916e-01, 2.539944363182475406e+00], 
-[1.668100537200059019e-01, 9.836734693877551283e-01, 2.844294599126995671e+00], 
-[1.668100537200059019e-01, 9.857142857142857650e-01, 3.232769499481473296e+00], 
-[1.668100537200059019e-01, 9.877551020408162907e-01, 3.746442458223802952e+00], 
-[1.668100537200059019e-01, 9.897959183673469274e-01, 4.458609218671225172e+00], 
-[1.668100537200059019e-01, 9.918367346938775642e-01, 5.514363039653980891e+00], 
-[1.668100537200059019e-01, 9.938775510204082009e-01, 7.247972350418633525e+00], 
-[1.668100537200059019e-01, 9.959183673469387266e-01, 1.064536727654377124e+01], 
-[1.668100537200059019e-01, 9.979591836734693633e-01, 2.050595031511043942e+01], 
-[1.668100537200059019e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.830738280295369780e-01, 1.000000000000000021e-03, 3.198186051599548330e-02], 
-[1.830738280295369780e-01, 1.148922311909569708e-03, 3.195466472736030461e-02], 
-[1.830738280295369780e-01, 1.320022478803632065e-03, 3.192813124417481774e-02], 
-[1.830738280295369780e-01, 1.516603278119670137e-03, 3.190235904136952405e-02], 
-[1.830738280295369780e-01, 1.742459344546885402e-03, 3.187746206463808879e-02], 
-[1.830738280295369780e-01, 2.001950418545241171e-03, 3.185357155178797361e-02], 
-[1.830738280295369780e-01, 2.300085503203331758e-03, 3.183083873218798404e-02], 
-[1.830738280295369780e-01, 2.642619553930058204e-03, 3.180943797115301508e-02], 
-[1.830738280295369780e-01, 3.036164567398761706e-03, 3.178957043993844989e-02], 
-[1.830738280295369780e-01, 3.488317214113704091e-03, 3.177146840871787614e-02], 
-[1.830738280295369780e-01, 4.007805478313466660e-03, 3.175540028072204590e-02], 
-[1.830738280295369780e-01, 4.604657135827751671e-03, 3.174167651186893951e-02], 
-[1.830738280295369780e-01, 5.290393322046124149e-03, 3.173065659281611856e-02], 
-[1.830738280295369780e-01, 6.078250926476181683e-03, 3.172275731207477995e-02], 
-[1.830738280295369780e-01, 6.983438106813499684e-03, 3.171846257152943771e-02], 
-[1.830738280295369780e-01, 8.023427854757562983e-03, 3.171833509350341362e-02], 
-[1.830738280295369780e-01, 9.218295280327699903e-03, 3.172303044585268045e-02], 
-[1.830738280295369780e-01, 1.059110512533918171e-02, 3.173331392490282704e-02], 
-[1.830738280295369780e-01, 1.216835698628199354e-02, 3.175008098422356373e-02], 
-[1.830738280295369780e-01, 1.398049684082008047e-02, 3.177438209176323969e-02], 
-[1.830738280295369780e-01, 1.606250475199945058e-02, 3.180745315586704786e-02], 
-[1.830738280295369780e-01, 1.845457009472566828e-02, 3.185075300429941747e-02], 
-[1.830738280295369780e-01, 2.120286733852943389e-02, 3.190600986222539431e-02], 
-[1.830738280295369780e-01, 2.436044736169515681e-02, 3.197527940034426003e-02], 
-[1.830738280295369780e-01, 2.798826150195019707e-02, 3.206101777808734871e-02], 
-[1.830738280295369780e-01, 3.215633811115024138e-02, 3.216617428300271031e-02], 
-[1.830738280295369780e-01, 3.694513432520856594e-02, 3.229430980378913268e-02], 
-[1.830738280295369780e-01, 4.244708914272822542e-02, 3.244974967506497610e-02], 
-[1.830738280295369780e-01, 4.876840779169493850e-02, 3.263778270400863324e-02], 
-[1.830738280295369780e-01, 5.603111182818285713e-02, 3.286492290180784148e-02], 
-[1.830738280295369780e-01, 6.437539454049952259e-02, 3.313925732583358069e-02], 
-[1.830738280295369780e-01, 7.396232712556144451e-02, 3.347091364630406379e-02], 
-[1.830738280295369780e-01, 8.497696787531199003e-02, 3.387269644970890975e-02], 
-[1.830738280295369780e-01, 9.763193439036874088e-02, 3.436096496247440651e-02], 
-[1.830738280295369780e-01, 1.121715077759858903e-01, 3.495686204103761602e-02], 
-[1.830738280295369780e-01, 1.288763480443681220e-01, 3.568806400885353447e-02], 
-[1.830738280295369780e-01, 1.480689117455977755e-01, 3.659131951280382433e-02], 
-[1.830738280295369780e-01, 1.701196764046864207e-01, 3.771621324103392736e-02], 
-[1.830738280295369780e-01, 1.954542919161802172e-01, 3.913088536146230173e-02], 
-[1.830738280295369780e-01, 2.245617969409859638e-01, 4.093097727754517468e-02], 
-[1.830738280295369780e-01, 2.580040589080049296e-01, 4.325410734998018369e-02], 
-[1.830738280295369780e-01, 2.964266198426381838e-01, 4.630426478163218729e-02], 
-[1.830738280295369780e-01, 3.405711573811430193e-01, 5.039498858619285981e-02], 
-[1.830738280295369780e-01, 3.912898015080607528e-01, 5.603057959905868857e-02], 
-[1.830738280295369780e-01, 4.495615833752782953e-01, 6.407102207178810849e-02], 
-[1.830738280295369780e-01, 5.165113337172515529e-01, 7.610212392426313199e-02], 
-[1.830738280295369780e-01, 5.934313956619206021e-01, 9.538749787985964512e-02], 
-[1.830738280295369780e-01, 6.818065710636164178e-01, 1.298544587062640532e-01], 
-[1.830738280295369780e-01, 7.833427819015473803e-01, 2.050477572387731651e-01], 
-[1.830738280295369780e-01, 9.000000000000000222e-01, 4.762577325777310744e-01], 
-[1.830738280295369780e-01, 9.020408163265306589e-01, 4.865943184507409147e-01], 
-[1.830738280295369780e-01, 9.040816326530612956e-01, 4.973594393565707317e-01], 
-[1.830738280295369780e-01, 9.061224489795918213e-01, 5.085804712419528251e-01], 
-[1.830738280295369780e-01, 9.081632653061224580e-01, 5.202871860921581826e-01], 
-[1.830738280295369780e-01, 9.102040816326530948e-01, 5.325120208395461852e-01], 
-[1.830738280295369780e-01, 9.122448979591837315e-01, 5.452903834039053432e-01], 
-[1.830738280295369780e-01, 9.142857142857142572e-01, 5.586610019974929120e-01], 
-[1.830738280295369780e-01, 9.163265306122448939e-01, 5.726663250147325801e-01], 
-[1.830738280295369780e-01, 9.183673469387755306e-01, 5.873529802789605458e-01], 
-[1.830738280295369780e-01, 9.204081632653061673e-01, 6.027723042035524337e-01], 
-[1.830738280295369780e-01, 9.224489795918368040e-01, 6.189809536295911574e-01], 
-[1.830738280295369780e-01, 9.244897959183673297e-01, 6.360416158394804897e-01], 
-[1.830738280295369780e-01, 9.265306122448979664e-01, 6.540238356624299421e-01], 
-[1.830738280295369780e-01, 9.285714285714286031e-01, 6.730049828764316233e-01], 
-[1.830738280295369780e-01, 9.306122448979592399e-01, 6.930713885272167252e-01], 
-[1.830738280295369780e-01, 9.326530612244897656e-01, 7.143196856664657535e-01], 
-[1.830738280295369780e-01, 9.346938775510204023e-01, 7.368583988149298714e-01], 
-[1.830738280295369780e-01, 9.367346938775510390e-01, 7.608098377964825909e-01], 
-[1.830738280295369780e-01, 9.387755102040816757e-01, 7.863123663064377489e-01], 
-[1.830738280295369780e-01, 9.408163265306123124e-01, 8.135231348283642472e-01], 
-[1.830738280295369780e-01, 9.428571428571428381e-01, 8.426213929064139130e-01], 
-[1.830738280295369780e-01, 9.448979591836734748e-01, 8.738125295738354836e-01], 
-[1.830738280295369780e-01, 9.469387755102041115e-01, 9.073330361420967050e-01], 
-[1.830738280295369780e-01, 9.489795918367347483e-01, 9.434566471806873356e-01], 
-[1.830738280295369780e-01, 9.510204081632652739e-01, 9.825020000776023554e-01], 
-[1.830738280295369780e-01, 9.530612244897959107e-01, 1.024842270966577429e+00], 
-[1.830738280295369780e-01, 9.551020408163265474e-01, 1.070917409859746705e+00], 
-[1.830738280295369780e-01, 9.571428571428571841e-01, 1.121249833066681800e+00], 
-[1.830738280295369780e-01, 9.591836734693878208e-01, 1.176464771256514164e+00], 
-[1.830738280295369780e-01, 9.612244897959183465e-01, 1.237316971712198566e+00], 
-[1.830738280295369780e-01, 9.632653061224489832e-01, 1.304726201630068694e+00], 
-[1.830738280295369780e-01, 9.653061224489796199e-01, 1.379825140608528233e+00], 
-[1.830738280295369780e-01, 9.673469387755102566e-01, 1.464025028535681061e+00], 
-[1.830738280295369780e-01, 9.693877551020407823e-01, 1.559107271239624559e+00], 
-[1.830738280295369780e-01, 9.714285714285714191e-01, 1.667353850498240808e+00], 
-[1.830738280295369780e-01, 9.734693877551020558e-01, 1.791737217319514963e+00], 
-[1.830738280295369780e-01, 9.755102040816326925e-01, 1.936204003449842448e+00], 
-[1.830738280295369780e-01, 9.775510204081632182e-01, 2.106111617228549449e+00], 
-[1.830738280295369780e-01, 9.795918367346938549e-01, 2.308923579222096123e+00], 
-[1.830738280295369780e-01, 9.816326530612244916e-01, 2.555362599823255643e+00], 
-[1.830738280295369780e-01, 9.836734693877551283e-01, 2.861417338488688067e+00], 
-[1.830738280295369780e-01, 9.857142857142857650e-01, 3.252046414892352910e+00], 
-[1.830738280295369780e-01, 9.877551020408162907e-01, 3.768535321843778263e+00], 
-[1.830738280295369780e-01, 9.897959183673469274e-01, 4.484553503580343659e+00], 
-[1.830738280295369780e-01, 9.918367346938775642e-01, 5.545922714416171573e+00], 
-[1.830738280295369780e-01, 9.938775510204082009e-01, 7.288557547739228148e+00], 
-[1.830738280295369780e-01, 9.959183673469387266e-01, 1.070311714606812004e+01], 
-[1.830738280295369780e-01, 9.979591836734693633e-01, 2.061105508521802676e+01], 
-[1.830738280295369780e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[2.009233002565047888e-01, 1.000000000000000021e-03, 3.224401812369212528e-02], 
-[2.009233002565047888e-01, 1.148922311909569708e-03, 3.221636200535711592e-02], 
-[2.009233002565047888e-01, 1.320022478803632065e-03, 3.218937322043088911e-02], 
-[2.009233002565047888e-01, 1.516603278119670137e-03, 3.216315149022880293e-02], 
-[2.009233002565047888e-01, 1.742459344546885402e-03, 3.213781161899038202e-02], 
-[2.009233002565047888e-01, 2.001950418545241171e-03, 3.211348583252798816e-02], 
-[2.009233002565047888e-01, 2.300085503203331758e-03, 3.209032649776191737e-02], 
-[2.009233002565047888e-01, 2.642619553930058204e-03, 3.206850929049240989e-02], 
-[2.009233002565047888e-01, 3.036164567398761706e-03, 3.204823689267233960e-02], 
-[2.009233002565047888e-01, 3.488317214113704091e-03, 3.202974331727282548e-02], 
-[2.009233002565047888e-01, 4.007805478313466660e-03, 3.201329897979365152e-02], 
-[2.009233002565047888e-01, 4.604657135827751671e-03, 3.199921666180674529e-02], 
-[2.009233002565047888e-01, 5.290393322046124149e-03, 3.198785854477670387e-02], 
-[2.009233002565047888e-01, 6.078250926476181683e-03, 3.197964453440022004e-02], 
-[2.009233002565047888e-01, 6.983438106813499684e-03, 3.197506214880973391e-02], 
-[2.009233002565047888e-01, 8.023427854757562983e-03, 3.197467831227495533e-02], 
-[2.009233002565047888e-01, 9.218295280327699903e-03, 3.197915348401831476e-02], 
-[2.009233002565047888e-01, 1.059110512533918171e-02, 3.198925866592479406e-02], 
-[2.009233002565047888e-01, 1.216835698628199354e-02, 3.200589598217999654e-02], 
-[2.009233002565047888e-01, 1.398049684082008047e-02, 3.203012371983154916e-02], 
-[2.009233002565047888e-01, 1.606250475199945058e-02, 3.206318697913277532e-02], 
-[2.009233002565047888e-01, 1.845457009472566828e-02, 3.210655542863178474e-02], 
-[2.009233002565047888e-01, 2.120286733852943389e-02, 3.216197012514923625e-02], 
-[2.009233002565047888e-01, 2.436044736169515681e-02, 3.223150198855210397e-02], 
-[2.009233002565047888e-01, 2.798826150195019707e-02, 3.231762538111541960e-02], 
-[2.009233002565047888e-01, 3.215633811115024138e-02, 3.242331142594835625e-02], 
-[2.009233002565047888e-01, 3.694513432520856594e-02, 3.255214734706225049e-02], 
-[2.009233002565047888e-01, 4.244708914272822542e-02, 3.270849043077259100e-02], 
-[2.009233002565047888e-01, 4.876840779169493850e-02, 3.289766850357043332e-02], 
-[2.009233002565047888e-01, 5.603111182818285713e-02, 3.312624356799508119e-02], 
-[2.009233002565047888e-01, 6.437539454049952259e-02, 3.340236216993593132e-02], 
-[2.009233002565047888e-01, 7.396232712556144451e-02, 3.373622635096640288e-02], 
-[2.009233002565047888e-01, 8.497696787531199003e-02, 3.414073454655439099e-02], 
-[2.009233002565047888e-01, 9.763193439036874088e-02, 3.463236562879064978e-02], 
-[2.009233002565047888e-01, 1.121715077759858903e-01, 3.523241671554915716e-02], 
-[2.009233002565047888e-01, 1.288763480443681220e-01, 3.596876551961972202e-02], 
-[2.009233002565047888e-01, 1.480689117455977755e-01, 3.687842728925538882e-02], 
-[2.009233002565047888e-01, 1.701196764046864207e-01, 3.801134522277863081e-02], 
-[2.009233002565047888e-01, 1.954542919161802172e-01, 3.943615029188757282e-02], 
-[2.009233002565047888e-01, 2.245617969409859638e-01, 4.124916985052751173e-02], 
-[2.009233002565047888e-01, 2.580040589080049296e-01, 4.358900451308359014e-02], 
-[2.009233002565047888e-01, 2.964266198426381838e-01, 4.666109149093723707e-02], 
-[2.009233002565047888e-01, 3.405711573811430193e-01, 5.078118153177269001e-02], 
-[2.009233002565047888e-01, 3.912898015080607528e-01, 5.645710724903471589e-02], 
-[2.009233002565047888e-01, 4.495615833752782953e-01, 6.455482508463915303e-02], 
-[2.009233002565047888e-01, 5.165113337172515529e-01, 7.667104596883814183e-02], 
-[2.009233002565047888e-01, 5.934313956619206021e-01, 9.609154877550377116e-02], 
-[2.009233002565047888e-01, 6.818065710636164178e-01, 1.307966573785867836e-01], 
-[2.009233002565047888e-01, 7.833427819015473803e-01, 2.064982775604616294e-01], 
-[2.009233002565047888e-01, 9.000000000000000222e-01, 4.794651310397235466e-01], 
-[2.009233002565047888e-01, 9.020408163265306589e-01, 4.898670326773987838e-01], 
-[2.009233002565047888e-01, 9.040816326530612956e-01, 5.007000758380800720e-01], 
-[2.009233002565047888e-01, 9.061224489795918213e-01, 5.119917986773506735e-01], 
-[2.009233002565047888e-01, 9.081632653061224580e-01, 5.237721493055673694e-01], 
-[2.009233002565047888e-01, 9.102040816326530948e-01, 5.360737562329349615e-01], 
-[2.009233002565047888e-01, 9.122448979591837315e-01, 5.489322361556063790e-01], 
-[2.009233002565047888e-01, 9.142857142857142572e-01, 5.623865452498630901e-01], 
-[2.009233002565047888e-01, 9.163265306122448939e-01, 5.764793813350027607e-01], 
-[2.009233002565047888e-01, 9.183673469387755306e-01, 5.912576457259948182e-01], 
-[2.009233002565047888e-01, 9.204081632653061673e-01, 6.067729753916801805e-01], 
-[2.009233002565047888e-01, 9.224489795918368040e-01, 6.230823582512075021e-01], 
-[2.009233002565047888e-01, 9.244897959183673297e-01, 6.402488471935958714e-01], 
-[2.009233002565047888e-01, 9.265306122448979664e-01, 6.583423918404738284e-01], 
-[2.009233002565047888e-01, 9.285714285714286031e-01, 6.774408113840774126e-01], 
-[2.009233002565047888e-01, 9.306122448979592399e-01, 6.976309372778901619e-01], 
-[2.009233002565047888e-01, 9.326530612244897656e-01, 7.190099614763787450e-01], 
-[2.009233002565047888e-01, 9.346938775510204023e-01, 7.416870347712801737e-01], 
-[2.009233002565047888e-01, 9.367346938775510390e-01, 7.657851711734460221e-01], 
-[2.009233002565047888e-01, 9.387755102040816757e-01, 7.914435290857869676e-01], 
-[2.009233002565047888e-01, 9.408163265306123124e-01, 8.188201593671213807e-01], 
-[2.009233002565047888e-01, 9.428571428571428381e-01, 8.480953359155348759e-01], 
-[2.009233002565047888e-01, 9.448979591836734748e-01, 8.794756183740275457e-01], 
-[2.009233002565047888e-01, 9.469387755102041115e-01, 9.131988422068773037e-01], 
-[2.009233002565047888e-01, 9.489795918367347483e-01, 9.495402933481762453e-01], 
-[2.009233002565047888e-01, 9.510204081632652739e-01, 9.888204096318390368e-01], 
-[2.009233002565047888e-01, 9.530612244897959107e-01, 1.031414469228402409e+00], 
-[2.009233002565047888e-01, 9.551020408163265474e-01, 1.077764892235374639e+00], 
-[2.009233002565047888e-01, 9.571428571428571841e-01, 1.128397018044412947e+00], 
-[2.009233002565047888e-01, 9.591836734693878208e-01, 1.183939563163455055e+00], 
-[2.009233002565047888e-01, 9.612244897959183465e-01, 1.245151466969986576e+00], 
-[2.009233002565047888e-01, 9.632653061224489832e-01, 1.312957585059111754e+00], 
-[2.009233002565047888e-01, 9.653061224489796199e-01, 1.388496837039745690e+00], 
-[2.009233002565047888e-01, 9.673469387755102566e-01, 1.473188202849525785e+00], 
-[2.009233002565047888e-01, 9.693877551020407823e-01, 1.568822812344421447e+00], 
-[2.009233002565047888e-01, 9.714285714285714191e-01, 1.677695040833917517e+00], 
-[2.009233002565047888e-01, 9.734693877551020558e-01, 1.802793395281791611e+00], 
-[2.009233002565047888e-01, 9.755102040816326925e-01, 1.948085700840529455e+00], 
-[2.009233002565047888e-01, 9.775510204081632182e-01, 2.118957952595201366e+00], 
-[2.009233002565047888e-01, 9.795918367346938549e-01, 2.322913219897793091e+00], 
-[2.009233002565047888e-01, 9.816326530612244916e-01, 2.570730598419226354e+00], 
-[2.009233002565047888e-01, 9.836734693877551283e-01, 2.878482109722678928e+00], 
-[2.009233002565047888e-01, 9.857142857142857650e-01, 3.271255258350371786e+00], 
-[2.009233002565047888e-01, 9.877551020408162907e-01, 3.790546398561458918e+00], 
-[2.009233002565047888e-01, 9.897959183673469274e-01, 4.510396418770477922e+00], 
-[2.009233002565047888e-01, 9.918367346938775642e-01, 5.577350988692602485e+00], 
-[2.009233002565047888e-01, 9.938775510204082009e-01, 7.328959998180762270e+00], 
-[2.009233002565047888e-01, 9.959183673469387266e-01, 1.076057833972320310e+01], 
-[2.009233002565047888e-01, 9.979591836734693633e-01, 2.071553976458059054e+01], 
-[2.009233002565047888e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[2.205130739903045645e-01, 1.000000000000000021e-03, 3.250653316458332331e-02], 
-[2.205130739903045645e-01, 1.148922311909569708e-03, 3.247841259607109343e-02], 
-[2.205130739903045645e-01, 1.320022478803632065e-03, 3.245096438977010389e-02], 
-[2.205130739903045645e-01, 1.516603278119670137e-03, 3.242428901343481773e-02], 
-[2.205130739903045645e-01, 1.742459344546885402e-03, 3.239850212990308398e-02], 
-[2.205130739903045645e-01, 2.001950418545241171e-03, 3.237373695304025106e-02], 
-[2.205130739903045645e-01, 2.300085503203331758e-03, 3.235014698735998867e-02], 
-[2.205130739903045645e-01, 2.642619553930058204e-03, 3.232790921918040489e-02], 
-[2.205130739903045645e-01, 3.036164567398761706e-03, 3.230722784118283952e-02], 
-[2.205130739903045645e-01, 3.488317214113704091e-03, 3.228833860910367698e-02], 
-[2.205130739903045645e-01, 4.007805478313466660e-03, 3.227151395072475060e-02], 
-[2.205130739903045645e-01, 4.604657135827751671e-03, 3.225706897320883282e-02], 
-[2.205130739903045645e-01, 5.290393322046124149e-03, 3.224536854873662206e-02], 
-[2.205130739903045645e-01, 6.078250926476181683e-03, 3.223683570004910737e-02], 
-[2.205130739903045645e-01, 6.983438106813499684e-03, 3.223196156132154128e-02], 
-[2.205130739903045645e-01, 8.023427854757562983e-03, 3.223131725848363272e-02], 
-[2.205130739903045645e-01, 9.218295280327699903e-03, 3.223556814173544893e-02], 
-[2.205130739903045645e-01, 1.059110512533918171e-02, 3.224549091800268941e-02], 
-[2.205130739903045645e-01, 1.216835698628199354e-02, 3.226199438140417430e-02], 
-[2.205130739903045645e-01, 1.398049684082008047e-02, 3.228614463719629152e-02], 
-[2.205130739903045645e-01, 1.606250475199945058e-02, 3.231919597638567565e-02], 
-[2.205130739903045645e-01, 1.845457009472566828e-02, 3.236262890681199100e-02], 
-[2.205130739903045645e-01, 2.120286733852943389e-02, 3.241819731502626478e-02], 
-[2.205130739903045645e-01, 2.436044736169515681e-02, 3.248798736757849137e-02], 
-[2.205130739903045645e-01, 2.798826150195019707e-02, 3.257449162637433143e-02], 
-[2.205130739903045645e-01, 3.215633811115024138e-02, 3.268070304591490921e-02], 
-[2.205130739903045645e-01, 3.694513432520856594e-02, 3.281023518008809037e-02], 
-[2.205130739903045645e-01, 4.244708914272822542e-02, 3.296747725977539761e-02], 
-[2.205130739903045645e-01, 4.876840779169493850e-02, 3.315779612135693472e-02], 
-[2.205130739903045645e-01, 5.603111182818285713e-02, 3.338780174616488849e-02], 
-[2.205130739903045645e-01, 6.437539454049952259e-02, 3.366570015171058139e-02], 
-[2.205130739903045645e-01, 7.396232712556144451e-02, 3.400176772794993862e-02], 
-[2.205130739903045645e-01, 8.497696787531199003e-02, 3.440899672773424511e-02], 
-[2.205130739903045645e-01, 9.763193439036874088e-02, 3.490398562482071448e-02], 
-[2.205130739903045645e-01, 1.121715077759858903e-01, 3.550818573641625203e-02], 
-[2.205130739903045645e-01, 1.288763480443681220e-01, 3.624967607568780475e-02], 
-[2.205130739903045645e-01, 1.480689117455977755e-01, 3.716573836277134446e-02], 
-[2.205130739903045645e-01, 1.701196764046864207e-01, 3.830667411429566904e-02], 
-[2.205130739903045645e-01, 1.954542919161802172e-01, 3.974160481569378317e-02], 
-[2.205130739903045645e-01, 2.245617969409859638e-01, 4.156754332282460579e-02], 
-[2.205130739903045645e-01, 2.580040589080049296e-01, 4.392407179131817274e-02], 
-[2.205130739903045645e-01, 2.964266198426381838e-01, 4.701807427319656951e-02], 
-[2.205130739903045645e-01, 3.405711573811430193e-01, 5.116751126053783322e-02], 
-[2.205130739903045645e-01, 3.912898015080607528e-01, 5.688374358820522114e-02], 
-[2.205130739903045645e-01, 4.495615833752782953e-01, 6.503869312364624067e-02], 
-[2.205130739903045645e-01, 5.165113337172515529e-01, 7.723995982635178947e-02], 
-[2.205130739903045645e-01, 5.934313956619206021e-01, 9.679545624241681079e-02], 
-[2.205130739903045645e-01, 6.818065710636164178e-01, 1.317384252892432606e-01], 
-[2.205130739903045645e-01, 7.833427819015473803e-01, 2.079475892847442720e-01], 
-[2.205130739903045645e-01, 9.000000000000000222e-01, 4.826675137284781036e-01], 
-[2.205130739903045645e-01, 9.020408163265306589e-01, 4.931345650520002621e-01], 
-[2.205130739903045645e-01, 9.040816326530612956e-01, 5.040353562324401127e-01], 
-[2.205130739903045645e-01, 9.061224489795918213e-01, 5.153975870612828025e-01], 
-[2.205130739903045645e-01, 9.081632653061224580e-01, 5.272513811475755263e-01], 
-[2.205130739903045645e-01, 9.102040816326530948e-01, 5.396295578932379655e-01], 
-[2.205130739903045645e-01, 9.122448979591837315e-01, 5.525679420177320722e-01], 
-[2.205130739903045645e-01, 9.142857142857142572e-01, 5.661057168331342648e-01], 
-[2.205130739903045645e-01, 9.163265306122448939e-01, 5.802858286707304192e-01], 
-[2.205130739903045645e-01, 9.183673469387755306e-01, 5.951554513286316794e-01], 
-[2.205130739903045645e-01, 9.204081632653061673e-01, 6.107665212143731370e-01], 
-[2.205130739903045645e-01, 9.224489795918368040e-01, 6.271763560853889086e-01], 
-[2.205130739903045645e-01, 9.244897959183673297e-01, 6.444483730573430380e-01], 
-[2.205130739903045645e-01, 9.265306122448979664e-01, 6.626529250040031904e-01], 
-[2.205130739903045645e-01, 9.285714285714286031e-01, 6.818682788076080303e-01], 
-[2.205130739903045645e-01, 9.306122448979592399e-01, 7.021817643932500852e-01], 
-[2.205130739903045645e-01, 9.326530612244897656e-01, 7.236911304369945119e-01], 
-[2.205130739903045645e-01, 9.346938775510204023e-01, 7.465061515358173416e-01], 
-[2.205130739903045645e-01, 9.367346938775510390e-01, 7.707505430898914378e-01], 
-[2.205130739903045645e-01, 9.387755102040816757e-01, 7.965642550230995766e-01], 
-[2.205130739903045645e-01, 9.408163265306123124e-01, 8.241062349247728624e-01], 
-[2.205130739903045645e-01, 9.428571428571428381e-01, 8.535577768597558679e-01], 
-[2.205130739903045645e-01, 9.448979591836734748e-01, 8.851266062476841334e-01], 
-[2.205130739903045645e-01, 9.469387755102041115e-01, 9.190518970986250036e-01], 
-[2.205130739903045645e-01, 9.489795918367347483e-01, 9.556104801709606189e-01], 
-[2.205130739903045645e-01, 9.510204081632652739e-01, 9.951245860707622626e-01], 
-[2.205130739903045645e-01, 9.530612244897959107e-01, 1.037971585944579944e+00], 
-[2.205130739903045645e-01, 9.551020408163265474e-01, 1.084596359203186200e+00], 
-[2.205130739903045645e-01, 9.571428571428571841e-01, 1.135527155417862977e+00], 
-[2.205130739903045645e-01, 9.591836734693878208e-01, 1.191396161354996597e+00], 
-[2.205130739903045645e-01, 9.612244897959183465e-01, 1.252966489504128145e+00], 
-[2.205130739903045645e-01, 9.632653061224489832e-01, 1.321168060503647101e+00], 
-[2.205130739903045645e-01, 9.653061224489796199e-01, 1.397146004923589313e+00], 
-[2.205130739903045645e-01, 9.673469387755102566e-01, 1.482327006181106688e+00], 
-[2.205130739903045645e-01, 9.693877551020407823e-01, 1.578511871496661279e+00], 
-[2.205130739903045645e-01, 9.714285714285714191e-01, 1.688007309256481125e+00], 
-[2.205130739903045645e-01, 9.734693877551020558e-01, 1.813817802693951542e+00], 
-[2.205130739903045645e-01, 9.755102040816326925e-01, 1.959932263235445227e+00], 
-[2.205130739903045645e-01, 9.775510204081632182e-01, 2.131765125348701773e+00], 
-[2.205130739903045645e-01, 9.795918367346938549e-01, 2.336858798970166351e+00], 
-[2.205130739903045645e-01, 9.816326530612244916e-01, 2.586048461396512010e+00], 
-[2.205130739903045645e-01, 9.836734693877551283e-01, 2.895489036118480186e+00], 
-[2.205130739903045645e-01, 9.857142857142857650e-01, 3.290396181411372467e+00], 
-[2.205130739903045645e-01, 9.877551020408162907e-01, 3.812475879848115312e+00], 
-[2.205130739903045645e-01, 9.897959183673469274e-01, 4.536138215288612940e+00], 
-[2.205130739903045645e-01, 9.918367346938775642e-01, 5.608648209669900631e+00], 
-[2.205130739903045645e-01, 9.938775510204082009e-01, 7.369180223642827876e+00], 
-[2.205130739903045645e-01, 9.959183673469387266e-01, 1.081775176907321345e+01], 
-[2.205130739903045645e-01, 9.979591836734693633e-01, 2.081940663360598975e+01], 
-[2.205130739903045645e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[2.420128264794383366e-01, 1.000000000000000021e-03, 3.276940588476102284e-02], 
-[2.420128264794383366e-01, 1.148922311909569708e-03, 3.274081673867602904e-02], 
-[2.420128264794383366e-01, 1.320022478803632065e-03, 3.271290498443955863e-02], 
-[2.420128264794383366e-01, 1.516603278119670137e-03, 3.268577183629829686e-02], 
-[2.420128264794383366e-01, 1.742459344546885402e-03, 3.265953381573932085e-02], 
-[2.420128264794383366e-01, 2.001950418545241171e-03, 3.263432512472760200e-02], 
-[2.420128264794383366e-01, 2.300085503203331758e-03, 3.261030040541015168e-02], 
-[2.420128264794383366e-01, 2.642619553930058204e-03, 3.258763795465337287e-02], 
-[2.420128264794383366e-01, 3.036164567398761706e-03, 3.256654347587210202e-02], 
-[2.420128264794383366e-01, 3.488317214113704091e-03, 3.254725446760385610e-02], 
-[2.420128264794383366e-01, 4.007805478313466660e-03, 3.253004536985137918e-02], 
-[2.420128264794383366e-01, 4.604657135827751671e-03, 3.251523361532531603e-02], 
-[2.420128264794383366e-01, 5.290393322046124149e-03, 3.250318676682727170e-02], 
-[2.420128264794383366e-01, 6.078250926476181683e-03, 3.249433096399656495e-02], 
-[2.420128264794383366e-01, 6.983438106813499684e-03, 3.248916095684051264e-02], 
-[2.420128264794383366e-01, 8.023427854757562983e-03, 3.248825207265615411e-02], 
-[2.420128264794383366e-01, 9.218295280327699903e-03, 3.249227455222484379e-02], 
-[2.420128264794383366e-01, 1.059110512533918171e-02, 3.250201080698573997e-02], 
-[2.420128264794383366e-01, 1.216835698628199354e-02, 3.251837630029827397e-02], 
-[2.420128264794383366e-01, 1.398049684082008047e-02, 3.254244495472538579e-02], 
-[2.420128264794383366e-01, 1.606250475199945058e-02, 3.257548025085864329e-02], 
-[2.420128264794383366e-01, 1.845457009472566828e-02, 3.261897353432116620e-02], 
-[2.420128264794383366e-01, 2.120286733852943389e-02, 3.267469151945050221e-02], 
-[2.420128264794383366e-01, 2.436044736169515681e-02, 3.274473561697294893e-02], 
-[2.420128264794383366e-01, 2.798826150195019707e-02, 3.283161658518564396e-02], 
-[2.420128264794383366e-01, 3.215633811115024138e-02, 3.293834920578151554e-02], 
-[2.420128264794383366e-01, 3.694513432520856594e-02, 3.306857335705210010e-02], 
-[2.420128264794383366e-01, 4.244708914272822542e-02, 3.322671020726948587e-02], 
-[2.420128264794383366e-01, 4.876840779169493850e-02, 3.341816559322585006e-02], 
-[2.420128264794383366e-01, 5.603111182818285713e-02, 3.364959746242292271e-02], 
-[2.420128264794383366e-01, 6.437539454049952259e-02, 3.392927128701861417e-02], 
-[2.420128264794383366e-01, 7.396232712556144451e-02, 3.426753778228180947e-02], 
-[2.420128264794383366e-01, 8.497696787531199003e-02, 3.467748298673280216e-02], 
-[2.420128264794383366e-01, 9.763193439036874088e-02, 3.517582493164844726e-02], 
-[2.420128264794383366e-01, 1.121715077759858903e-01, 3.578416907127813379e-02], 
-[2.420128264794383366e-01, 1.288763480443681220e-01, 3.653079562997253726e-02], 
-[2.420128264794383366e-01, 1.480689117455977755e-01, 3.745325266996160640e-02], 
-[2.420128264794383366e-01, 1.701196764046864207e-01, 3.860219983392383647e-02], 
-[2.420128264794383366e-01, 1.954542919161802172e-01, 4.004724883048184358e-02], 
-[2.420128264794383366e-01, 2.245617969409859638e-01, 4.188609756817920221e-02], 
-[2.420128264794383366e-01, 2.580040589080049296e-01, 4.425930903058949289e-02], 
-[2.420128264794383366e-01, 2.964266198426381838e-01, 4.737521294136983613e-02], 
-[2.420128264794383366e-01, 3.405711573811430193e-01, 5.155397754592059428e-02], 
-[2.420128264794383366e-01, 3.912898015080607528e-01, 5.731048834204438558e-02], 
-[2.420128264794383366e-01, 4.495615833752782953e-01, 6.552262585585102994e-02], 
-[2.420128264794383366e-01, 5.165113337172515529e-01, 7.780886509381526595e-02], 
-[2.420128264794383366e-01, 5.934313956619206021e-01, 9.749921980099351959e-02], 
-[2.420128264794383366e-01, 6.818065710636164178e-01, 1.326797619130146988e-01], 
-[2.420128264794383366e-01, 7.833427819015473803e-01, 2.093956921231849289e-01], 
-[2.420128264794383366e-01, 9.000000000000000222e-01, 4.858648840544893543e-01], 
-[2.420128264794383366e-01, 9.020408163265306589e-01, 4.963969191973214290e-01], 
-[2.420128264794383366e-01, 9.040816326530612956e-01, 5.073652843883347252e-01], 
-[2.420128264794383366e-01, 9.061224489795918213e-01, 5.187978404830781987e-01], 
-[2.420128264794383366e-01, 9.081632653061224580e-01, 5.307248859641229277e-01], 
-[2.420128264794383366e-01, 9.102040816326530948e-01, 5.431794304403297913e-01], 
-[2.420128264794383366e-01, 9.122448979591837315e-01, 5.561975059029168333e-01], 
-[2.420128264794383366e-01, 9.142857142857142572e-01, 5.698185219731953799e-01], 
-[2.420128264794383366e-01, 9.163265306122448939e-01, 5.840856725834097096e-01], 
-[2.420128264794383366e-01, 9.183673469387755306e-01, 5.990464030083924030e-01], 
-[2.420128264794383366e-01, 9.204081632653061673e-01, 6.147529479799175300e-01], 
-[2.420128264794383366e-01, 9.224489795918368040e-01, 6.312629538565197596e-01], 
-[2.420128264794383366e-01, 9.244897959183673297e-01, 6.486402006034563961e-01], 
-[2.420128264794383366e-01, 9.265306122448979664e-01, 6.669554428096466925e-01], 
-[2.420128264794383366e-01, 9.285714285714286031e-01, 6.862873933268103244e-01], 
-[2.420128264794383366e-01, 9.306122448979592399e-01, 7.067238786197297395e-01], 
-[2.420128264794383366e-01, 9.326530612244897656e-01, 7.283632019096888399e-01], 
-[2.420128264794383366e-01, 9.346938775510204023e-01, 7.513157591386518952e-01], 
-[2.420128264794383366e-01, 9.367346938775510390e-01, 7.757059643047576891e-01], 
-[2.420128264794383366e-01, 9.387755102040816757e-01, 8.016745556734923284e-01], 
-[2.420128264794383366e-01, 9.408163265306123124e-01, 8.293813739283779629e-01], 
-[2.420128264794383366e-01, 9.428571428571428381e-01, 8.590087291235917188e-01], 
-[2.420128264794383366e-01, 9.448979591836734748e-01, 8.907655076336951083e-01], 
-[2.420128264794383366e-01, 9.469387755102041115e-01, 9.248922164209159025e-01], 
-[2.420128264794383366e-01, 9.489795918367347483e-01, 9.616672245434295663e-01], 
-[2.420128264794383366e-01, 9.510204081632652739e-01, 1.001414547724494453e+00], 
-[2.420128264794383366e-01, 9.530612244897959107e-01, 1.044513641048367969e+00], 
-[2.420128264794383366e-01, 9.551020408163265474e-01, 1.091411832494071144e+00], 
-[2.420128264794383366e-01, 9.571428571428571841e-01, 1.142640268942939574e+00], 
-[2.420128264794383366e-01, 9.591836734693878208e-01, 1.198834591879753164e+00], 
-[2.420128264794383366e-01, 9.612244897959183465e-01, 1.260762067973446143e+00], 
-[2.420128264794383366e-01, 9.632653061224489832e-01, 1.329357659612439235e+00], 
-[2.420128264794383366e-01, 9.653061224489796199e-01, 1.405772679357128130e+00], 
-[2.420128264794383366e-01, 9.673469387755102566e-01, 1.491441477634762425e+00], 
-[2.420128264794383366e-01, 9.693877551020407823e-01, 1.588174492497497425e+00], 
-[2.420128264794383366e-01, 9.714285714285714191e-01, 1.698290705125632627e+00], 
-[2.420128264794383366e-01, 9.734693877551020558e-01, 1.824810495567197766e+00], 
-[2.420128264794383366e-01, 9.755102040816326925e-01, 1.971743754707236729e+00], 
-[2.420128264794383366e-01, 9.775510204081632182e-01, 2.144533209478200142e+00], 
-[2.420128264794383366e-01, 9.795918367346938549e-01, 2.350760402842746011e+00], 
-[2.420128264794383366e-01, 9.816326530612244916e-01, 2.601316291030654426e+00], 
-[2.420128264794383366e-01, 9.836734693877551283e-01, 2.912438240772962317e+00], 
-[2.420128264794383366e-01, 9.857142857142857650e-01, 3.309469335378898869e+00], 
-[2.420128264794383366e-01, 9.877551020408162907e-01, 3.834323956834156277e+00], 
-[2.420128264794383366e-01, 9.897959183673469274e-01, 4.561779143701272687e+00], 
-[2.420128264794383366e-01, 9.918367346938775642e-01, 5.639814723814723152e+00], 
-[2.420128264794383366e-01, 9.938775510204082009e-01, 7.409218744837430037e+00], 
-[2.420128264794383366e-01, 9.959183673469387266e-01, 1.087463834335503599e+01], 
-[2.420128264794383366e-01, 9.979591836734693633e-01, 2.092265796582073989e+01], 
-[2.420128264794383366e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[2.656087782946686682e-01, 1.000000000000000021e-03, 3.303263653038779335e-02], 
-[2.656087782946686682e-01, 1.148922311909569708e-03, 3.300357467241225862e-02], 
-[2.656087782946686682e-01, 1.320022478803632065e-03, 3.297519523674885544e-02], 
-[2.656087782946686682e-01, 1.516603278119670137e-03, 3.294760018418826930e-02], 
-[2.656087782946686682e-01, 1.742459344546885402e-03, 3.292090689491646710e-02], 
-[2.656087782946686682e-01, 2.001950418545241171e-03, 3.289525055904300721e-02], 
-[2.656087782946686682e-01, 2.300085503203331758e-03, 3.287078695638638581e-02], 
-[2.656087782946686682e-01, 2.642619553930058204e-03, 3.284769569438972248e-02], 
-[2.656087782946686682e-01, 3.036164567398761706e-03, 3.282618398721610931e-02], 
-[2.656087782946686682e-01, 3.488317214113704091e-03, 3.280649107620058763e-02], 
-[2.656087782946686682e-01, 4.007805478313466660e-03, 3.278889341353936893e-02], 
-[2.656087782946686682e-01, 4.604657135827751671e-03, 3.277371075743193418e-02], 
-[2.656087782946686682e-01, 5.290393322046124149e-03, 3.276131336120158277e-02], 
-[2.656087782946686682e-01, 6.078250926476181683e-03, 3.275213048123515325e-02], 
-[2.656087782946686682e-01, 6.983438106813499684e-03, 3.274666048315571371e-02], 
-[2.656087782946686682e-01, 8.023427854757562983e-03, 3.274548289532854678e-02], 
-[2.656087782946686682e-01, 9.218295280327699903e-03, 3.274927284871254063e-02], 
-[2.656087782946686682e-01, 1.059110512533918171e-02, 3.275881845872446324e-02], 
-[2.656087782946686682e-01, 1.216835698628199354e-02, 3.277504185726173164e-02], 
-[2.656087782946686682e-01, 1.398049684082008047e-02, 3.279902478328000637e-02], 
-[2.656087782946686682e-01, 1.606250475199945058e-02, 3.283203990577383824e-02], 
-[2.656087782946686682e-01, 1.845457009472566828e-02, 3.287558940662582696e-02], 
-[2.656087782946686682e-01, 2.120286733852943389e-02, 3.293145282599747870e-02], 
-[2.656087782946686682e-01, 2.436044736169515681e-02, 3.300174681626263234e-02], 
-[2.656087782946686682e-01, 2.798826150195019707e-02, 3.308900032884477815e-02], 
-[2.656087782946686682e-01, 3.215633811115024138e-02, 3.319624996839758146e-02], 
-[2.656087782946686682e-01, 3.694513432520856594e-02, 3.332716193210637917e-02], 
-[2.656087782946686682e-01, 4.244708914272822542e-02, 3.348618931841518265e-02], 
-[2.656087782946686682e-01, 4.876840779169493850e-02, 3.367877695499489621e-02], 
-[2.656087782946686682e-01, 5.603111182818285713e-02, 3.391163074283184975e-02], 
-[2.656087782946686682e-01, 6.437539454049952259e-02, 3.419307559167537175e-02], 
-[2.656087782946686682e-01, 7.396232712556144451e-02, 3.453353651894108811e-02], 
-[2.656087782946686682e-01, 8.497696787531199003e-02, 3.494619331698447379e-02], 
-[2.656087782946686682e-01, 9.763193439036874088e-02, 3.544788353030660366e-02], 
-[2.656087782946686682e-01, 1.121715077759858903e-01, 3.606036668772258369e-02], 
-[2.656087782946686682e-01, 1.288763480443681220e-01, 3.681212413533793693e-02], 
-[2.656087782946686682e-01, 1.480689117455977755e-01, 3.774097014738773959e-02], 
-[2.656087782946686682e-01, 1.701196764046864207e-01, 3.889792229995790718e-02], 
-[2.656087782946686682e-01, 1.954542919161802172e-01, 4.035308223381585402e-02], 
-[2.656087782946686682e-01, 2.245617969409859638e-01, 4.220483246030854591e-02], 
-[2.656087782946686682e-01, 2.580040589080049296e-01, 4.459471607679484778e-02], 
-[2.656087782946686682e-01, 2.964266198426381838e-01, 4.773250730843422301e-02], 
-[2.656087782946686682e-01, 3.405711573811430193e-01, 5.194058016140969125e-02], 
-[2.656087782946686682e-01, 3.912898015080607528e-01, 5.773734123614217284e-02], 
-[2.656087782946686682e-01, 4.495615833752782953e-01, 6.600662294850397072e-02], 
-[2.656087782946686682e-01, 5.165113337172515529e-01, 7.837776136860102882e-02], 
-[2.656087782946686682e-01, 5.934313956619206021e-01, 9.820283897224185710e-02], 
-[2.656087782946686682e-01, 6.818065710636164178e-01, 1.336206667257713032e-01], 
-[2.656087782946686682e-01, 7.833427819015473803e-01, 2.108425857893830857e-01], 
-[2.656087782946686682e-01, 9.000000000000000222e-01, 4.890572454309284334e-01], 
-[2.656087782946686682e-01, 9.020408163265306589e-01, 4.996540987387375621e-01], 
-[2.656087782946686682e-01, 9.040816326530612956e-01, 5.106898641569567188e-01], 
-[2.656087782946686682e-01, 9.061224489795918213e-01, 5.221925630344738112e-01], 
-[2.656087782946686682e-01, 9.081632653061224580e-01, 5.341926681034413482e-01], 
-[2.656087782946686682e-01, 9.102040816326530948e-01, 5.467233784962446386e-01], 
-[2.656087782946686682e-01, 9.122448979591837315e-01, 5.598209327258049095e-01], 
-[2.656087782946686682e-01, 9.142857142857142572e-01, 5.735249658977756848e-01], 
-[2.656087782946686682e-01, 9.163265306122448939e-01, 5.878789186361836894e-01], 
-[2.656087782946686682e-01, 9.183673469387755306e-01, 6.029305066882316710e-01], 
-[2.656087782946686682e-01, 9.204081632653061673e-01, 6.187322619977890792e-01], 
-[2.656087782946686682e-01, 9.224489795918368040e-01, 6.353421582898994835e-01], 
-[2.656087782946686682e-01, 9.244897959183673297e-01, 6.528243370052766448e-01], 
-[2.656087782946686682e-01, 9.265306122448979664e-01, 6.712499529142887944e-01], 
-[2.656087782946686682e-01, 9.285714285714286031e-01, 6.906981631213335859e-01], 
-[2.656087782946686682e-01, 9.306122448979592399e-01, 7.112572887031798352e-01], 
-[2.656087782946686682e-01, 9.326530612244897656e-01, 7.330261852547534929e-01], 
-[2.656087782946686682e-01, 9.346938775510204023e-01, 7.561158676082408991e-01], 
-[2.656087782946686682e-01, 9.367346938775510390e-01, 7.806514455746871306e-01], 
-[2.656087782946686682e-01, 9.387755102040816757e-01, 8.067744425890730486e-01], 
-[2.656087782946686682e-01, 9.408163265306123124e-01, 8.346455888011430346e-01], 
-[2.656087782946686682e-01, 9.428571428571428381e-01, 8.644482060867597628e-01], 
-[2.656087782946686682e-01, 9.448979591836734748e-01, 8.963923369650763640e-01], 
-[2.656087782946686682e-01, 9.469387755102041115e-01, 9.307198157702207819e-01], 
-[2.656087782946686682e-01, 9.489795918367347483e-01, 9.677105433514543442e-01], 
-[2.656087782946686682e-01, 9.510204081632652739e-01, 1.007690312913013919e+00], 
-[2.656087782946686682e-01, 9.530612244897959107e-01, 1.051040654461004697e+00], 
-[2.656087782946686682e-01, 9.551020408163265474e-01, 1.098211333824715918e+00], 
-[2.656087782946686682e-01, 9.571428571428571841e-01, 1.149736382358812925e+00], 
-[2.656087782946686682e-01, 9.591836734693878208e-01, 1.206254880766626680e+00], 
-[2.656087782946686682e-01, 9.612244897959183465e-01, 1.268538231013551121e+00], 
-[2.656087782946686682e-01, 9.632653061224489832e-01, 1.337526414006893649e+00], 
-[2.656087782946686682e-01, 9.653061224489796199e-01, 1.414376895405120127e+00], 
-[2.656087782946686682e-01, 9.673469387755102566e-01, 1.500531656276570924e+00], 
-[2.656087782946686682e-01, 9.693877551020407823e-01, 1.597810719102579213e+00], 
-[2.656087782946686682e-01, 9.714285714285714191e-01, 1.708545277746730484e+00], 
-[2.656087782946686682e-01, 9.734693877551020558e-01, 1.835771529847398220e+00], 
-[2.656087782946686682e-01, 9.755102040816326925e-01, 1.983520239249394024e+00], 
-[2.656087782946686682e-01, 9.775510204081632182e-01, 2.157262278876022066e+00], 
-[2.656087782946686682e-01, 9.795918367346938549e-01, 2.364618117799230479e+00], 
-[2.656087782946686682e-01, 9.816326530612244916e-01, 2.616534189446705572e+00], 
-[2.656087782946686682e-01, 9.836734693877551283e-01, 2.929329846590514652e+00], 
-[2.656087782946686682e-01, 9.857142857142857650e-01, 3.328474871304417881e+00], 
-[2.656087782946686682e-01, 9.877551020408162907e-01, 3.856090820309505673e+00], 
-[2.656087782946686682e-01, 9.897959183673469274e-01, 4.587319454095135640e+00], 
-[2.656087782946686682e-01, 9.918367346938775642e-01, 5.670850876874828472e+00], 
-[2.656087782946686682e-01, 9.938775510204082009e-01, 7.449076081291163831e+00], 
-[2.656087782946686682e-01, 9.959183673469387266e-01, 1.093123896948270080e+01], 
-[2.656087782946686682e-01, 9.979591836734693633e-01, 2.102529602788804652e+01], 
-[2.656087782946686682e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[2.915053062825178620e-01, 1.000000000000000021e-03, 3.329622534769693248e-02], 
-[2.915053062825178620e-01, 1.148922311909569708e-03, 3.326668663658677305e-02], 
-[2.915053062825178620e-01, 1.320022478803632065e-03, 3.323783537907011587e-02], 
-[2.915053062825178620e-01, 1.516603278119670137e-03, 3.320977428253230057e-02], 
-[2.915053062825178620e-01, 1.742459344546885402e-03, 3.318262158590632588e-02], 
-[2.915053062825178620e-01, 2.001950418545241171e-03, 3.315651346748973993e-02], 
-[2.915053062825178620e-01, 2.300085503203331758e-03, 3.313160684480894597e-02], 
-[2.915053062825178620e-01, 2.642619553930058204e-03, 3.310808263590994671e-02], 
-[2.915053062825178620e-01, 3.036164567398761706e-03, 3.308614956571658688e-02], 
-[2.915053062825178620e-01, 3.488317214113704091e-03, 3.306604861835502063e-02], 
-[2.915053062825178620e-01, 4.007805478313466660e-03, 3.304805825818429854e-02], 
-[2.915053062825178620e-01, 4.604657135827751671e-03, 3.303250056883020452e-02], 
-[2.915053062825178620e-01, 5.290393322046124149e-03, 3.301974849403422479e-02], 
-[2.915053062825178620e-01, 6.078250926476181683e-03, 3.301023440677505749e-02], 
-[2.915053062825178620e-01, 6.983438106813499684e-03, 3.300446028806977572e-02], 
-[2.915053062825178620e-01, 8.023427854757562983e-03, 3.300300986704633038e-02], 
-[2.915053062825178620e-01, 9.218295280327699903e-03, 3.300656316443001392e-02], 
-[2.915053062825178620e-01, 1.059110512533918171e-02, 3.301591399907077840e-02], 
-[2.915053062825178620e-01, 1.216835698628199354e-02, 3.303199117069137436e-02], 
-[2.915053062825178620e-01, 1.398049684082008047e-02, 3.305588423371476348e-02], 
-[2.915053062825178620e-01, 1.606250475199945058e-02, 3.308887504434288723e-02], 
-[2.915053062825178620e-01, 1.845457009472566828e-02, 3.313247661917800846e-02], 
-[2.915053062825178620e-01, 2.120286733852943389e-02, 3.318848132222433633e-02], 
-[2.915053062825178620e-01, 2.436044736169515681e-02, 3.325902104495251366e-02], 
-[2.915053062825178620e-01, 2.798826150195019707e-02, 3.334664292862123125e-02], 
-[2.915053062825178620e-01, 3.215633811115024138e-02, 3.345440539658287027e-02], 
-[2.915053062825178620e-01, 3.694513432520856594e-02, 3.358600095936985219e-02], 
-[2.915053062825178620e-01, 4.244708914272822542e-02, 3.374591463833312432e-02], 
-[2.915053062825178620e-01, 4.876840779169493850e-02, 3.393963024244198157e-02], 
-[2.915053062825178620e-01, 5.603111182818285713e-02, 3.417390161341150867e-02], 
-[2.915053062825178620e-01, 6.437539454049952259e-02, 3.445711308145064933e-02], 
-[2.915053062825178620e-01, 7.396232712556144451e-02, 3.479976394285895502e-02], 
-[2.915053062825178620e-01, 8.497696787531199003e-02, 3.521512771187392671e-02], 
-[2.915053062825178620e-01, 9.763193439036874088e-02, 3.572016140177697308e-02], 
-[2.915053062825178620e-01, 1.121715077759858903e-01, 3.633677855328605599e-02], 
-[2.915053062825178620e-01, 1.288763480443681220e-01, 3.709366154459752679e-02], 
-[2.915053062825178620e-01, 1.480689117455977755e-01, 3.802889073156306976e-02], 
-[2.915053062825178620e-01, 1.701196764046864207e-01, 3.919384143064880838e-02], 
-[2.915053062825178620e-01, 1.954542919161802172e-01, 4.065910492322342973e-02], 
-[2.915053062825178620e-01, 2.245617969409859638e-01, 4.252374787290473523e-02], 
-[2.915053062825178620e-01, 2.580040589080049296e-01, 4.493029277582352710e-02], 
-[2.915053062825178620e-01, 2.964266198426381838e-01, 4.808995718738476310e-02], 
-[2.915053062825178620e-01, 3.405711573811430193e-01, 5.232731888055059538e-02], 
-[2.915053062825178620e-01, 3.912898015080607528e-01, 5.816430199620471059e-02], 
-[2.915053062825178620e-01, 4.495615833752782953e-01, 6.649068406906459561e-02], 
-[2.915053062825178620e-01, 5.165113337172515529e-01, 7.894664824843650175e-02], 
-[2.915053062825178620e-01, 5.934313956619206021e-01, 9.890631327779289550e-02], 
-[2.915053062825178620e-01, 6.818065710636164178e-01, 1.345611392044809562e-01], 
-[2.915053062825178620e-01, 7.833427819015473803e-01, 2.122882699989727950e-01], 
-[2.915053062825178620e-01, 9.000000000000000222e-01, 4.922446012736318988e-01], 
-[2.915053062825178620e-01, 9.020408163265306589e-01, 5.029061073042112584e-01], 
-[2.915053062825178620e-01, 9.040816326530612956e-01, 5.140090993919972373e-01], 
-[2.915053062825178620e-01, 9.061224489795918213e-01, 5.255817588096018955e-01], 
-[2.915053062825178620e-01, 9.081632653061224580e-01, 5.376547319160427385e-01], 
-[2.915053062825178620e-01, 9.102040816326530948e-01, 5.502614066851638785e-01], 
-[2.915053062825178620e-01, 9.122448979591837315e-01, 5.634382274030382831e-01], 
-[2.915053062825178620e-01, 9.142857142857142572e-01, 5.772250538364323003e-01], 
-[2.915053062825178620e-01, 9.163265306122448939e-01, 5.916655723938326616e-01], 
-[2.915053062825178620e-01, 9.183673469387755306e-01, 6.068077682925245853e-01], 
-[2.915053062825178620e-01, 9.204081632653061673e-01, 6.227044695786401185e-01], 
-[2.915053062825178620e-01, 9.224489795918368040e-01, 6.394139761117292320e-01], 
-[2.915053062825178620e-01, 9.244897959183673297e-01, 6.570007894367349000e-01], 
-[2.915053062825178620e-01, 9.265306122448979664e-01, 6.755364629750555405e-01], 
-[2.915053062825178620e-01, 9.285714285714286031e-01, 6.951005963706731183e-01], 
-[2.915053062825178620e-01, 9.306122448979592399e-01, 7.157820033888526723e-01], 
-[2.915053062825178620e-01, 9.326530612244897656e-01, 7.376800898313781163e-01], 
-[2.915053062825178620e-01, 9.346938775510204023e-01, 7.609064869713719759e-01], 
-[2.915053062825178620e-01, 9.367346938775510390e-01, 7.855869976540048594e-01], 
-[2.915053062825178620e-01, 9.387755102040816757e-01, 8.118639273188894556e-01], 
-[2.915053062825178620e-01, 9.408163265306123124e-01, 8.398988919624017502e-01], 
-[2.915053062825178620e-01, 9.428571428571428381e-01, 8.698762211241617415e-01], 
-[2.915053062825178620e-01, 9.448979591836734748e-01, 9.020071086689520623e-01], 
-[2.915053062825178620e-01, 9.469387755102041115e-01, 9.365347107358883427e-01], 
-[2.915053062825178620e-01, 9.489795918367347483e-01, 9.737404534723705929e-01], 
-[2.915053062825178620e-01, 9.510204081632652739e-01, 1.013951899946137880e+00], 
-[2.915053062825178620e-01, 9.530612244897959107e-01, 1.057552646091686421e+00], 
-[2.915053062825178620e-01, 9.551020408163265474e-01, 1.104994884897590790e+00], 
-[2.915053062825178620e-01, 9.571428571428571841e-01, 1.156815519387896396e+00], 
-[2.915053062825178620e-01, 9.591836734693878208e-01, 1.213657054024793958e+00], 
-[2.915053062825178620e-01, 9.612244897959183465e-01, 1.276295007236829537e+00], 
-[2.915053062825178620e-01, 9.632653061224489832e-01, 1.345674355281046841e+00], 
-[2.915053062825178620e-01, 9.653061224489796199e-01, 1.422958688100007585e+00], 
-[2.915053062825178620e-01, 9.673469387755102566e-01, 1.509597581134344502e+00], 
-[2.915053062825178620e-01, 9.693877551020407823e-01, 1.607420595022126530e+00], 
-[2.915053062825178620e-01, 9.714285714285714191e-01, 1.718771076370798401e+00], 
-[2.915053062825178620e-01, 9.734693877551020558e-01, 1.846700961415108866e+00], 
-[2.915053062825178620e-01, 9.755102040816326925e-01, 1.995261780776283356e+00], 
-[2.915053062825178620e-01, 9.775510204081632182e-01, 2.169952407337727429e+00], 
-[2.915053062825178620e-01, 9.795918367346938549e-01, 2.378432030003569064e+00], 
-[2.915053062825178620e-01, 9.816326530612244916e-01, 2.631702258619363910e+00], 
-[2.915053062825178620e-01, 9.836734693877551283e-01, 2.946163976283227459e+00], 
-[2.915053062825178620e-01, 9.857142857142857650e-01, 3.347412939987617353e+00], 
-[2.915053062825178620e-01, 9.877551020408162907e-01, 3.877776660724027380e+00], 
-[2.915053062825178620e-01, 9.897959183673469274e-01, 4.612759396077754204e+00], 
-[2.915053062825178620e-01, 9.918367346938775642e-01, 5.701757013880259350e+00], 
-[2.915053062825178620e-01, 9.938775510204082009e-01, 7.488752751347391268e+00], 
-[2.915053062825178620e-01, 9.959183673469387266e-01, 1.098755455205275844e+01], 
-[2.915053062825178620e-01, 9.979591836734693633e-01, 2.112732307962568967e+01], 
-[2.915053062825178620e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[3.199267137797384697e-01, 1.000000000000000021e-03, 3.356017258299243133e-02], 
-[3.199267137797384697e-01, 1.148922311909569708e-03, 3.353015287057314886e-02], 
-[3.199267137797384697e-01, 1.320022478803632065e-03, 3.350082564383794620e-02], 
-[3.199267137797384697e-01, 1.516603278119670137e-03, 3.347229435681626369e-02], 
-[3.199267137797384697e-01, 1.742459344546885402e-03, 3.344467810723494861e-02], 
-[3.199267137797384697e-01, 2.001950418545241171e-03, 3.341811406162130405e-02], 
-[3.199267137797384697e-01, 2.300085503203331758e-03, 3.339276027524411966e-02], 
-[3.199267137797384697e-01, 2.642619553930058204e-03, 3.336879897677653278e-02], 
-[3.199267137797384697e-01, 3.036164567398761706e-03, 3.334644040191316050e-02], 
-[3.199267137797384697e-01, 3.488317214113704091e-03, 3.332592727756213818e-02], 
-[3.199267137797384697e-01, 4.007805478313466660e-03, 3.330754008021157009e-02], 
-[3.199267137797384697e-01, 4.604657135827751671e-03, 3.329160321884730434e-02], 
-[3.199267137797384697e-01, 5.290393322046124149e-03, 3.327849232752138481e-02], 
-[3.199267137797384697e-01, 6.078250926476181683e-03, 3.326864289564399058e-02], 
-[3.199267137797384697e-01, 6.983438106813499684e-03, 3.326256051939874281e-02], 
-[3.199267137797384697e-01, 8.023427854757562983e-03, 3.326083312836440598e-02], 
-[3.199267137797384697e-01, 9.218295280327699903e-03, 3.326414563261413659e-02], 
-[3.199267137797384697e-01, 1.059110512533918171e-02, 3.327329755387792298e-02], 
-[3.199267137797384697e-01, 1.216835698628199354e-02, 3.328922435898134385e-02], 
-[3.199267137797384697e-01, 1.398049684082008047e-02, 3.331302341687753660e-02], 
-[3.199267137797384697e-01, 1.606250475199945058e-02, 3.334598576976675888e-02], 
-[3.199267137797384697e-01, 1.845457009472566828e-02, 3.338963526741516030e-02], 
-[3.199267137797384697e-01, 2.120286733852943389e-02, 3.344577709566977364e-02], 
-[3.199267137797384697e-01, 2.436044736169515681e-02, 3.351655838252531883e-02], 
-[3.199267137797384697e-01, 2.798826150195019707e-02, 3.360454445575845883e-02], 
-[3.199267137797384697e-01, 3.215633811115024138e-02, 3.371281555312744677e-02], 
-[3.199267137797384697e-01, 3.694513432520856594e-02, 3.384509049292817873e-02], 
-[3.199267137797384697e-01, 4.244708914272822542e-02, 3.400588621211045326e-02], 
-[3.199267137797384697e-01, 4.876840779169493850e-02, 3.420072549130510203e-02], 
-[3.199267137797384697e-01, 5.603111182818285713e-02, 3.443641010013881454e-02], 
-[3.199267137797384697e-01, 6.437539454049952259e-02, 3.472138377206861887e-02], 
-[3.199267137797384697e-01, 7.396232712556144451e-02, 3.506622005891863597e-02], 
-[3.199267137797384697e-01, 8.497696787531199003e-02, 3.548428616473604802e-02], 
-[3.199267137797384697e-01, 9.763193439036874088e-02, 3.599265852699035789e-02], 
-[3.199267137797384697e-01, 1.121715077759858903e-01, 3.661340463545366408e-02], 
-[3.199267137797384697e-01, 1.288763480443681220e-01, 3.737540781051425232e-02], 
-[3.199267137797384697e-01, 1.480689117455977755e-01, 3.831701435895262103e-02], 
-[3.199267137797384697e-01, 1.701196764046864207e-01, 3.948995714420359959e-02], 
-[3.199267137797384697e-01, 1.954542919161802172e-01, 4.096531679619552779e-02], 
-[3.199267137797384697e-01, 2.245617969409859638e-01, 4.284284367963454854e-02], 
-[3.199267137797384697e-01, 2.580040589080049296e-01, 4.526603897355675754e-02], 
-[3.199267137797384697e-01, 2.964266198426381838e-01, 4.844756239123422514e-02], 
-[3.199267137797384697e-01, 3.405711573811430193e-01, 5.271419347694541319e-02], 
-[3.199267137797384697e-01, 3.912898015080607528e-01, 5.859137034805410316e-02], 
-[3.199267137797384697e-01, 4.495615833752782953e-01, 6.697480888520293552e-02], 
-[3.199267137797384697e-01, 5.165113337172515529e-01, 7.951552533141378887e-02], 
-[3.199267137797384697e-01, 5.934313956619206021e-01, 9.960964223989350608e-02], 
-[3.199267137797384697e-01, 6.818065710636164178e-01, 1.355011788272014739e-01], 
-[3.199267137797384697e-01, 7.833427819015473803e-01, 2.137327444696129897e-01], 
-[3.199267137797384697e-01, 9.000000000000000222e-01, 4.954269550010858558e-01], 
-[3.199267137797384697e-01, 9.020408163265306589e-01, 5.061529485242758364e-01], 
-[3.199267137797384697e-01, 9.040816326530612956e-01, 5.173229939496288843e-01], 
-[3.199267137797384697e-01, 9.061224489795918213e-01, 5.289654319049741371e-01], 
-[3.199267137797384697e-01, 9.081632653061224580e-01, 5.411110817546997964e-01], 
-[3.199267137797384697e-01, 9.102040816326530948e-01, 5.537935196333976240e-01], 
-[3.199267137797384697e-01, 9.122448979591837315e-01, 5.670493948532371320e-01], 
-[3.199267137797384697e-01, 9.142857142857142572e-01, 5.809187910205313443e-01], 
-[3.199267137797384697e-01, 9.163265306122448939e-01, 5.954456394227518601e-01], 
-[3.199267137797384697e-01, 9.183673469387755306e-01, 6.106781937470442401e-01], 
-[3.199267137797384697e-01, 9.204081632653061673e-01, 6.266695770342763927e-01], 
-[3.199267137797384697e-01, 9.224489795918368040e-01, 6.434784140490874549e-01], 
-[3.199267137797384697e-01, 9.244897959183673297e-01, 6.611695650723297124e-01], 
-[3.199267137797384697e-01, 9.265306122448979664e-01, 6.798149806492892466e-01], 
-[3.199267137797384697e-01, 9.285714285714286031e-01, 6.994947012541470333e-01], 
-[3.199267137797384697e-01, 9.306122448979592399e-01, 7.202980314213769386e-01], 
-[3.199267137797384697e-01, 9.326530612244897656e-01, 7.423249249976261455e-01], 
-[3.199267137797384697e-01, 9.346938775510204023e-01, 7.656876272531368821e-01], 
-[3.199267137797384697e-01, 9.367346938775510390e-01, 7.905126312947086120e-01], 
-[3.199267137797384697e-01, 9.387755102040816757e-01, 8.169430214089250519e-01], 
-[3.199267137797384697e-01, 9.408163265306123124e-01, 8.451412958275879017e-01], 
-[3.199267137797384697e-01, 9.428571428571428381e-01, 8.752927876058552714e-01], 
-[3.199267137797384697e-01, 9.448979591836734748e-01, 9.076098371665252129e-01], 
-[3.199267137797384697e-01, 9.469387755102041115e-01, 9.423369169001121204e-01], 
-[3.199267137797384697e-01, 9.489795918367347483e-01, 9.797569717749473606e-01], 
-[3.199267137797384697e-01, 9.510204081632652739e-01, 1.020199327123491040e+00], 
-[3.199267137797384697e-01, 9.530612244897959107e-01, 1.064049635837538865e+00], 
-[3.199267137797384697e-01, 9.551020408163265474e-01, 1.111762507400915423e+00], 
-[3.199267137797384697e-01, 9.571428571428571841e-01, 1.163877703735817448e+00], 
-[3.199267137797384697e-01, 9.591836734693878208e-01, 1.221041137643671615e+00], 
-[3.199267137797384697e-01, 9.612244897959183465e-01, 1.284032425232411345e+00], 
-[3.199267137797384697e-01, 9.632653061224489832e-01, 1.353801515001534117e+00], 
-[3.199267137797384697e-01, 9.653061224489796199e-01, 1.431518092441890877e+00], 
-[3.199267137797384697e-01, 9.673469387755102566e-01, 1.518639291197608321e+00], 
-[3.199267137797384697e-01, 9.693877551020407823e-01, 1.617004163920803927e+00], 
-[3.199267137797384697e-01, 9.714285714285714191e-01, 1.728968150194512443e+00], 
-[3.199267137797384697e-01, 9.734693877551020558e-01, 1.857598846085569244e+00], 
-[3.199267137797384697e-01, 9.755102040816326925e-01, 2.006968443123160029e+00], 
-[3.199267137797384697e-01, 9.775510204081632182e-01, 2.182603668562133947e+00], 
-[3.199267137797384697e-01, 9.795918367346938549e-01, 2.392202225500025481e+00], 
-[3.199267137797384697e-01, 9.816326530612244916e-01, 2.646820600373056553e+00], 
-[3.199267137797384697e-01, 9.836734693877551283e-01, 2.962940752371043374e+00], 
-[3.199267137797384697e-01, 9.857142857142857650e-01, 3.366283691976631687e+00], 
-[3.199267137797384697e-01, 9.877551020408162907e-01, 3.899381668187903660e+00], 
-[3.199267137797384697e-01, 9.897959183673469274e-01, 4.638099218778124921e+00], 
-[3.199267137797384697e-01, 9.918367346938775642e-01, 5.732533479144427346e+00], 
-[3.199267137797384697e-01, 9.938775510204082009e-01, 7.528249272168294759e+00], 
-[3.199267137797384697e-01, 9.959183673469387266e-01, 1.104358599334871371e+01], 
-[3.199267137797384697e-01, 9.979591836734693633e-01, 2.122874137402381578e+01], 
-[3.199267137797384697e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[3.511191734215134419e-01, 1.000000000000000021e-03, 3.382447848264896750e-02], 
-[3.511191734215134419e-01, 1.148922311909569708e-03, 3.379397361381155512e-02], 
-[3.511191734215134419e-01, 1.320022478803632065e-03, 3.376416626354948602e-02], 
-[3.511191734215134419e-01, 1.516603278119670137e-03, 3.373516063258451270e-02], 
-[3.511191734215134419e-01, 1.742459344546885402e-03, 3.370707667748271130e-02], 
-[3.511191734215134419e-01, 2.001950418545241171e-03, 3.368005255304136469e-02], 
-[3.511191734215134419e-01, 2.300085503203331758e-03, 3.365424745230436582e-02], 
-[3.511191734215134419e-01, 2.642619553930058204e-03, 3.362984491459406616e-02], 
-[3.511191734215134419e-01, 3.036164567398761706e-03, 3.360705668638341859e-02], 
-[3.511191734215134419e-01, 3.488317214113704091e-03, 3.358612723735079908e-02], 
-[3.511191734215134419e-01, 4.007805478313466660e-03, 3.356733905607632573e-02], 
-[3.511191734215134419e-01, 4.604657135827751671e-03, 3.355101887683609174e-02], 
-[3.511191734215134419e-01, 5.290393322046124149e-03, 3.353754502388092695e-02], 
-[3.511191734215134419e-01, 6.078250926476181683e-03, 3.352735610288715834e-02], 
-[3.511191734215134419e-01, 6.983438106813499684e-03, 3.352096132497217607e-02], 
-[3.511191734215134419e-01, 8.023427854757562983e-03, 3.351895281984713926e-02], 
-[3.511191734215134419e-01, 9.218295280327699903e-03, 3.352202038650708288e-02], 
-[3.511191734215134419e-01, 1.059110512533918171e-02, 3.353096924900048070e-02], 
-[3.511191734215134419e-01, 1.216835698628199354e-02, 3.354674154052309648e-02], 
-[3.511191734215134419e-01, 1.398049684082008047e-02, 3.357044244360958551e-02], 
-[3.511191734215134419e-01, 1.606250475199945058e-02, 3.360337218523580527e-02], 
-[3.511191734215134419e-01, 1.845457009472566828e-02, 3.364706544676019512e-02], 
-[3.511191734215134419e-01, 2.120286733852943389e-02, 3.370334023385405942e-02], 
-[3.511191734215134419e-01, 2.436044736169515681e-02, 3.377435890844147914e-02], 
-[3.511191734215134419e-01, 2.798826150195019707e-02, 3.386270498147393726e-02], 
-[3.511191734215134419e-01, 3.215633811115024138e-02, 3.397148050079170506e-02], 
-[3.511191734215134419e-01, 3.694513432520856594e-02, 3.410443058683381573e-02], 
-[3.511191734215134419e-01, 4.244708914272822542e-02, 3.426610408479660586e-02], 
-[3.511191734215134419e-01, 4.876840779169493850e-02, 3.446206273728236180e-02], 
-[3.511191734215134419e-01, 5.603111182818285713e-02, 3.469915622894782781e-02], 
-[3.511191734215134419e-01, 6.437539454049952259e-02, 3.498588767920787074e-02], 
-[3.511191734215134419e-01, 7.396232712556144451e-02, 3.533290487195545754e-02], 
-[3.511191734215134419e-01, 8.497696787531199003e-02, 3.575366866885592437e-02], 
-[3.511191734215134419e-01, 9.763193439036874088e-02, 3.626537488682661514e-02], 
-[3.511191734215134419e-01, 1.121715077759858903e-01, 3.689024490165923598e-02], 
-[3.511191734215134419e-01, 1.288763480443681220e-01, 3.765736288580048829e-02], 
-[3.511191734215134419e-01, 1.480689117455977755e-01, 3.860534096597323384e-02], 
-[3.511191734215134419e-01, 1.701196764046864207e-01, 3.978626935878550736e-02], 
-[3.511191734215134419e-01, 1.954542919161802172e-01, 4.127171775018659977e-02], 
-[3.511191734215134419e-01, 2.245617969409859638e-01, 4.316211975413963842e-02], 
-[3.511191734215134419e-01, 2.580040589080049296e-01, 4.560195451586780691e-02], 
-[3.511191734215134419e-01, 2.964266198426381838e-01, 4.880532273301325941e-02], 
-[3.511191734215134419e-01, 3.405711573811430193e-01, 5.310120372425299745e-02], 
-[3.511191734215134419e-01, 3.912898015080607528e-01, 5.901854601762862584e-02], 
-[3.511191734215134419e-01, 4.495615833752782953e-01, 6.745899706479280278e-02], 
-[3.511191734215134419e-01, 5.165113337172515529e-01, 8.008439221598293023e-02], 
-[3.511191734215134419e-01, 5.934313956619206021e-01, 1.003128253814077053e-01], 
-[3.511191734215134419e-01, 6.818065710636164178e-01, 1.364407850730812999e-01], 
-[3.511191734215134419e-01, 7.833427819015473803e-01, 2.151760089209933113e-01], 
-[3.511191734215134419e-01, 9.000000000000000222e-01, 4.986043100344135226e-01], 
-[3.511191734215134419e-01, 9.020408163265306589e-01, 5.093946260320235675e-01], 
-[3.511191734215134419e-01, 9.040816326530612956e-01, 5.206315516884921779e-01], 
-[3.511191734215134419e-01, 9.061224489795918213e-01, 5.323435864194663303e-01], 
-[3.511191734215134419e-01, 9.081632653061224580e-01, 5.445617219744336435e-01], 
-[3.511191734215134419e-01, 9.102040816326530948e-01, 5.573197219693710736e-01], 
-[3.511191734215134419e-01, 9.122448979591837315e-01, 5.706544399969856185e-01], 
-[3.511191734215134419e-01, 9.142857142857142572e-01, 5.846061826832307240e-01], 
-[3.511191734215134419e-01, 9.163265306122448939e-01, 5.992191252909377930e-01], 
-[3.511191734215134419e-01, 9.183673469387755306e-01, 6.145417889789484001e-01], 
-[3.511191734215134419e-01, 9.204081632653061673e-01, 6.306275906776429574e-01], 
-[3.511191734215134419e-01, 9.224489795918368040e-01, 6.475354788299156894e-01], 
-[3.511191734215134419e-01, 9.244897959183673297e-01, 6.653306710871114138e-01], 
-[3.511191734215134419e-01, 9.265306122448979664e-01, 6.840855135945341781e-01], 
-[3.511191734215134419e-01, 9.285714285714286031e-01, 7.038804859508782652e-01], 
-[3.511191734215134419e-01, 9.306122448979592399e-01, 7.248053815447400572e-01], 
-[3.511191734215134419e-01, 9.326530612244897656e-01, 7.469607001104151545e-01], 
-[3.511191734215134419e-01, 9.346938775510204023e-01, 7.704592984769121911e-01], 
-[3.511191734215134419e-01, 9.367346938775510390e-01, 7.954283572464240226e-01], 
-[3.511191734215134419e-01, 9.387755102040816757e-01, 8.220117364020720352e-01], 
-[3.511191734215134419e-01, 9.408163265306123124e-01, 8.503728128082153059e-01], 
-[3.511191734215134419e-01, 9.428571428571428381e-01, 8.806979188970331940e-01], 
-[3.511191734215134419e-01, 9.448979591836734748e-01, 9.132005368730564676e-01], 
-[3.511191734215134419e-01, 9.469387755102041115e-01, 9.481264498379132766e-01], 
-[3.511191734215134419e-01, 9.489795918367347483e-01, 9.857601151193663425e-01], 
-[3.511191734215134419e-01, 9.510204081632652739e-01, 1.026432612734483829e+00], 
-[3.511191734215134419e-01, 9.530612244897959107e-01, 1.070531643583597425e+00], 
-[3.511191734215134419e-01, 9.551020408163265474e-01, 1.118514223008642228e+00], 
-[3.511191734215134419e-01, 9.571428571428571841e-01, 1.170922959091397653e+00], 
-[3.511191734215134419e-01, 9.591836734693878208e-01, 1.228407157592904309e+00], 
-[3.511191734215134419e-01, 9.612244897959183465e-01, 1.291750513566156444e+00], 
-[3.511191734215134419e-01, 9.632653061224489832e-01, 1.361907924707580708e+00], 
-[3.511191734215134419e-01, 9.653061224489796199e-01, 1.440055143398517590e+00], 
-[3.511191734215134419e-01, 9.673469387755102566e-01, 1.527656825417593511e+00], 
-[3.511191734215134419e-01, 9.693877551020407823e-01, 1.626561469417790562e+00], 
-[3.511191734215134419e-01, 9.714285714285714191e-01, 1.739136548360212586e+00], 
-[3.511191734215134419e-01, 9.734693877551020558e-01, 1.868465239608716466e+00], 
-[3.511191734215134419e-01, 9.755102040816326925e-01, 2.018640290046199048e+00], 
-[3.511191734215134419e-01, 9.775510204081632182e-01, 2.195216136151376674e+00], 
-[3.511191734215134419e-01, 9.795918367346938549e-01, 2.405928790213244461e+00], 
-[3.511191734215134419e-01, 9.816326530612244916e-01, 2.661889316382066717e+00], 
-[3.511191734215134419e-01, 9.836734693877551283e-01, 2.979660297181938589e+00], 
-[3.511191734215134419e-01, 9.857142857142857650e-01, 3.385087277568318065e+00], 
-[3.511191734215134419e-01, 9.877551020408162907e-01, 3.920906032472070368e+00], 
-[3.511191734215134419e-01, 9.897959183673469274e-01, 4.663339170847422999e+00], 
-[3.511191734215134419e-01, 9.918367346938775642e-01, 5.763180616265236367e+00], 
-[3.511191734215134419e-01, 9.938775510204082009e-01, 7.567566159737067366e+00], 
-[3.511191734215134419e-01, 9.959183673469387266e-01, 1.109933419334630855e+01], 
-[3.511191734215134419e-01, 9.979591836734693633e-01, 2.132955315726218259e+01], 
-[3.511191734215134419e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[3.853528593710531247e-01, 1.000000000000000021e-03, 3.408914329311179409e-02], 
-[3.853528593710531247e-01, 1.148922311909569708e-03, 3.405814910580868410e-02], 
-[3.853528593710531247e-01, 1.320022478803632065e-03, 3.402785747076428335e-02], 
-[3.853528593710531247e-01, 1.516603278119670137e-03, 3.399837333543970219e-02], 
-[3.853528593710531247e-01, 1.742459344546885402e-03, 3.396981751528425214e-02], 
-[3.853528593710531247e-01, 2.001950418545241171e-03, 3.394232915340378298e-02], 
-[3.853528593710531247e-01, 2.300085503203331758e-03, 3.391606858064819680e-02], 
-[3.853528593710531247e-01, 2.642619553930058204e-03, 3.389122064700902937e-02], 
-[3.853528593710531247e-01, 3.036164567398761706e-03, 3.386799860974286369e-02], 
-[3.853528593710531247e-01, 3.488317214113704091e-03, 3.384664868128365450e-02], 
-[3.853528593710531247e-01, 4.007805478313466660e-03, 3.382745536226342692e-02], 
-[3.853528593710531247e-01, 4.604657135827751671e-03, 3.381074771217507102e-02], 
-[3.853528593710531247e-01, 5.290393322046124149e-03, 3.379690674535220513e-02], 
-[3.853528593710531247e-01, 6.078250926476181683e-03, 3.378637418356732203e-02], 
-[3.853528593710531247e-01, 6.983438106813499684e-03, 3.377966285263302171e-02], 
-[3.853528593710531247e-01, 8.023427854757562983e-03, 3.377736908206821487e-02], 
-[3.853528593710531247e-01, 9.218295280327699903e-03, 3.378018755935641160e-02], 
-[3.853528593710531247e-01, 1.059110512533918171e-02, 3.378892921029431201e-02], 
-[3.853528593710531247e-01, 1.216835698628199354e-02, 3.380454283370538937e-02], 
-[3.853528593710531247e-01, 1.398049684082008047e-02, 3.382814142474542540e-02], 
-[3.853528593710531247e-01, 1.606250475199945058e-02, 3.386103439392970649e-02], 
-[3.853528593710531247e-01, 1.845457009472566828e-02, 3.390476725262142610e-02], 
-[3.853528593710531247e-01, 2.120286733852943389e-02, 3.396117082427899114e-02], 
-[3.853528593710531247e-01, 2.436044736169515681e-02, 3.403242270213915205e-02], 
-[3.853528593710531247e-01, 2.798826150195019707e-02, 3.412112457695902490e-02], 
-[3.853528593710531247e-01, 3.215633811115024138e-02, 3.423040030230632691e-02], 
-[3.853528593710531247e-01, 3.694513432520856594e-02, 3.436402129510591347e-02], 
-[3.853528593710531247e-01, 4.244708914272822542e-02, 3.452656830140431871e-02], 
-[3.853528593710531247e-01, 4.876840779169493850e-02, 3.472364201603197337e-02], 
-[3.853528593710531247e-01, 5.603111182818285713e-02, 3.496214002572965024e-02], 
-[3.853528593710531247e-01, 6.437539454049952259e-02, 3.525062481850135820e-02], 
-[3.853528593710531247e-01, 7.396232712556144451e-02, 3.559981838675675692e-02], 
-[3.853528593710531247e-01, 8.497696787531199003e-02, 3.602327521746890443e-02], 
-[3.853528593710531247e-01, 9.763193439036874088e-02, 3.653831046211458017e-02], 
-[3.853528593710531247e-01, 1.121715077759858903e-01, 3.716729931928521025e-02], 
-[3.853528593710531247e-01, 1.288763480443681220e-01, 3.793952672311814295e-02], 
-[3.853528593710531247e-01, 1.480689117455977755e-01, 3.889387048899355104e-02], 
-[3.853528593710531247e-01, 1.701196764046864207e-01, 4.008277799251392520e-02], 
-[3.853528593710531247e-01, 1.954542919161802172e-01, 4.157830768261451537e-02], 
-[3.853528593710531247e-01, 2.245617969409859638e-01, 4.348157597003644154e-02], 
-[3.853528593710531247e-01, 2.580040589080049296e-01, 4.593803924862195631e-02], 
-[3.853528593710531247e-01, 2.964266198426381838e-01, 4.916323802577038382e-02], 
-[3.853528593710531247e-01, 3.405711573811430193e-01, 5.348834939618893336e-02], 
-[3.853528593710531247e-01, 3.912898015080607528e-01, 5.944582873098248899e-02], 
-[3.853528593710531247e-01, 4.495615833752782953e-01, 6.794324827592208849e-02], 
-[3.853528593710531247e-01, 5.165113337172515529e-01, 8.065324850095310916e-02], 
-[3.853528593710531247e-01, 5.934313956619206021e-01, 1.010158622258161276e-01], 
-[3.853528593710531247e-01, 6.818065710636164178e-01, 1.373799574223580622e-01], 
-[3.853528593710531247e-01, 7.833427819015473803e-01, 2.166180630748244518e-01], 
-[3.853528593710531247e-01, 9.000000000000000222e-01, 5.017766697973594647e-01], 
-[3.853528593710531247e-01, 9.020408163265306589e-01, 5.126311434630890229e-01], 
-[3.853528593710531247e-01, 9.040816326530612956e-01, 5.239347764696797860e-01], 
-[3.853528593710531247e-01, 9.061224489795918213e-01, 5.357162264543036123e-01], 
-[3.853528593710531247e-01, 9.081632653061224580e-01, 5.480066569324959502e-01], 
-[3.853528593710531247e-01, 9.102040816326530948e-01, 5.608400183236058600e-01], 
-[3.853528593710531247e-01, 9.122448979591837315e-01, 5.742533677568131267e-01], 
-[3.853528593710531247e-01, 9.142857142857142572e-01, 5.882872340594642591e-01], 
-[3.853528593710531247e-01, 9.163265306122448939e-01, 6.029860355679679262e-01], 
-[3.853528593710531247e-01, 9.183673469387755306e-01, 6.183985599167569625e-01], 
-[3.853528593710531247e-01, 9.204081632653061673e-01, 6.345785168228017525e-01], 
-[3.853528593710531247e-01, 9.224489795918368040e-01, 6.515851771829959116e-01], 
-[3.853528593710531247e-01, 9.244897959183673297e-01, 6.694841146566590240e-01], 
-[3.853528593710531247e-01, 9.265306122448979664e-01, 6.883480694685107926e-01], 
-[3.853528593710531247e-01, 9.285714285714286031e-01, 7.082579586397709237e-01], 
-[3.853528593710531247e-01, 9.306122448979592399e-01, 7.293040625022642054e-01], 
-[3.853528593710531247e-01, 9.326530612244897656e-01, 7.515874245254936525e-01], 
-[3.853528593710531247e-01, 9.346938775510204023e-01, 7.752215106643272069e-01], 
-[3.853528593710531247e-01, 9.367346938775510390e-01, 8.003341862563952969e-01], 
-[3.853528593710531247e-01, 9.387755102040816757e-01, 8.270700838381073172e-01], 
-[3.853528593710531247e-01, 9.408163265306123124e-01, 8.555934553118498265e-01], 
-[3.853528593710531247e-01, 9.428571428571428381e-01, 8.860916283579961528e-01], 
-[3.853528593710531247e-01, 9.448979591836734748e-01, 9.187792221978360319e-01], 
-[3.853528593710531247e-01, 9.469387755102041115e-01, 9.539033251171100680e-01], 
-[3.853528593710531247e-01, 9.489795918367347483e-01, 9.917499003571939031e-01], 
-[3.853528593710531247e-01, 9.510204081632652739e-01, 1.032651775058285537e+00], 
-[3.853528593710531247e-01, 9.530612244897959107e-01, 1.076998689202776305e+00], 
-[3.853528593710531247e-01, 9.551020408163265474e-01, 1.125250053380423276e+00], 
-[3.853528593710531247e-01, 9.571428571428571841e-01, 1.177951309126623158e+00], 
-[3.853528593710531247e-01, 9.591836734693878208e-01, 1.235755139822329651e+00], 
-[3.853528593710531247e-01, 9.612244897959183465e-01, 1.299449300780625816e+00], 
-[3.853528593710531247e-01, 9.632653061224489832e-01, 1.369993615910971352e+00], 
-[3.853528593710531247e-01, 9.653061224489796199e-01, 1.448569875905257875e+00], 
-[3.853528593710531247e-01, 9.673469387755102566e-01, 1.536650222707216518e+00], 
-[3.853528593710531247e-01, 9.693877551020407823e-01, 1.636092555086749112e+00], 
-[3.853528593710531247e-01, 9.714285714285714191e-01, 1.749276319955888059e+00], 
-[3.853528593710531247e-01, 9.734693877551020558e-01, 1.879300197669191430e+00], 
-[3.853528593710531247e-01, 9.755102040816326925e-01, 2.030277385222507114e+00], 
-[3.853528593710531247e-01, 9.775510204081632182e-01, 2.207789883610928872e+00], 
-[3.853528593710531247e-01, 9.795918367346938549e-01, 2.419611809948320591e+00], 
-[3.853528593710531247e-01, 9.816326530612244916e-01, 2.676908508170624756e+00], 
-[3.853528593710531247e-01, 9.836734693877551283e-01, 2.996322732852075621e+00], 
-[3.853528593710531247e-01, 9.857142857142857650e-01, 3.403823846808499365e+00], 
-[3.853528593710531247e-01, 9.877551020408162907e-01, 3.942349943008586877e+00], 
-[3.853528593710531247e-01, 9.897959183673469274e-01, 4.688479500459582283e+00], 
-[3.853528593710531247e-01, 9.918367346938775642e-01, 5.793698768126208876e+00], 
-[3.853528593710531247e-01, 9.938775510204082009e-01, 7.606703928859993802e+00], 
-[3.853528593710531247e-01, 9.959183673469387266e-01, 1.115480004971808015e+01], 
-[3.853528593710531247e-01, 9.979591836734693633e-01, 2.142976066872820695e+01], 
-[3.853528593710531247e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[4.229242874389498863e-01, 1.000000000000000021e-03, 3.435416726089700334e-02], 
-[4.229242874389498863e-01, 1.148922311909569708e-03, 3.432267958613788306e-02], 
-[4.229242874389498863e-01, 1.320022478803632065e-03, 3.429189949810444726e-02], 
-[4.229242874389498863e-01, 1.516603278119670137e-03, 3.426193269104298167e-02], 
-[4.229242874389498863e-01, 1.742459344546885402e-03, 3.423290083932856859e-02], 
-[4.229242874389498863e-01, 2.001950418545241171e-03, 3.420494407441271312e-02], 
-[4.229242874389498863e-01, 2.300085503203331758e-03, 3.417822386498033105e-02], 
-[4.229242874389498863e-01, 2.642619553930058204e-03, 3.415292637171007950e-02], 
-[4.229242874389498863e-01, 3.036164567398761706e-03, 3.412926636264498881e-02], 
-[4.229242874389498863e-01, 3.488317214113704091e-03, 3.410749179295727296e-02], 
-[4.229242874389498863e-01, 4.007805478313466660e-03, 3.408788917528757234e-02], 
-[4.229242874389498863e-01, 4.604657135827751671e-03, 3.407078989426851057e-02], 
-[4.229242874389498863e-01, 5.290393322046124149e-03, 3.405657765419631278e-02], 
-[4.229242874389498863e-01, 6.078250926476181683e-03, 3.404569729276479134e-02], 
-[4.229242874389498863e-01, 6.983438106813499684e-03, 3.403866525023779843e-02], 
-[4.229242874389498863e-01, 8.023427854757562983e-03, 3.403608205561080985e-02], 
-[4.229242874389498863e-01, 9.218295280327699903e-03, 3.403864728441508003e-02], 
-[4.229242874389498863e-01, 1.059110512533918171e-02, 3.404717756361673453e-02], 
-[4.229242874389498863e-01, 1.216835698628199354e-02, 3.406262835691434288e-02], 
-[4.229242874389498863e-01, 1.398049684082008047e-02, 3.408612047111302112e-02], 
-[4.229242874389498863e-01, 1.606250475199945058e-02, 3.411897249901761631e-02], 
-[4.229242874389498863e-01, 1.845457009472566828e-02, 3.416274078039270579e-02], 
-[4.229242874389498863e-01, 2.120286733852943389e-02, 3.421926895442800598e-02], 
-[4.229242874389498863e-01, 2.436044736169515681e-02, 3.429074984303431134e-02], 
-[4.229242874389498863e-01, 2.798826150195019707e-02, 3.437980331337922579e-02], 
-[4.229242874389498863e-01, 3.215633811115024138e-02, 3.448957502037241357e-02], 
-[4.229242874389498863e-01, 3.694513432520856594e-02, 3.462386267173053062e-02], 
-[4.229242874389498863e-01, 4.244708914272822542e-02, 3.478727890690981595e-02], 
-[4.229242874389498863e-01, 4.876840779169493850e-02, 3.498546336317238242e-02], 
-[4.229242874389498863e-01, 5.603111182818285713e-02, 3.522536151633265389e-02], 
-[4.229242874389498863e-01, 6.437539454049952259e-02, 3.551559520553657090e-02], 
-[4.229242874389498863e-01, 7.396232712556144451e-02, 3.586696060806208314e-02], 
-[4.229242874389498863e-01, 8.497696787531199003e-02, 3.629310580376066131e-02], 
-[4.229242874389498863e-01, 9.763193439036874088e-02, 3.681146523363230949e-02], 
-[4.229242874389498863e-01, 1.121715077759858903e-01, 3.744456785566294826e-02], 
-[4.229242874389498863e-01, 1.288763480443681220e-01, 3.822189927507871343e-02], 
-[4.229242874389498863e-01, 1.480689117455977755e-01, 3.918260286433410122e-02], 
-[4.229242874389498863e-01, 1.701196764046864207e-01, 4.037948296346464266e-02], 
-[4.229242874389498863e-01, 1.954542919161802172e-01, 4.188508649086085389e-02], 
-[4.229242874389498863e-01, 2.245617969409859638e-01, 4.380121220091638679e-02], 
-[4.229242874389498863e-01, 2.580040589080049296e-01, 4.627429301767675002e-02], 
-[4.229242874389498863e-01, 2.964266198426381838e-01, 4.952130808257212968e-02], 
-[4.229242874389498863e-01, 3.405711573811430193e-01, 5.387563026652576748e-02], 
-[4.229242874389498863e-01, 3.912898015080607528e-01, 5.987321821428796126e-02], 
-[4.229242874389498863e-01, 4.495615833752782953e-01, 6.842756218688589298e-02], 
-[4.229242874389498863e-01, 5.165113337172515529e-01, 8.122209378549298531e-02], 
-[4.229242874389498863e-01, 5.934313956619206021e-01, 1.017187522972158586e-01], 
-[4.229242874389498863e-01, 6.818065710636164178e-01, 1.383186953563581845e-01], 
-[4.229242874389498863e-01, 7.833427819015473803e-01, 2.180589066548371813e-01], 
-[4.229242874389498863e-01, 9.000000000000000222e-01, 5.049440377162807136e-01], 
-[4.229242874389498863e-01, 9.020408163265306589e-01, 5.158625044556381933e-01], 
-[4.229242874389498863e-01, 9.040816326530612956e-01, 5.272326721567239805e-01], 
-[4.229242874389498863e-01, 9.061224489795918213e-01, 5.390833561130468077e-01], 
-[4.229242874389498863e-01, 9.081632653061224580e-01, 5.514458909883561688e-01], 
-[4.229242874389498863e-01, 9.102040816326530948e-01, 5.643544133287082820e-01], 
-[4.229242874389498863e-01, 9.122448979591837315e-01, 5.778461830571819391e-01], 
-[4.229242874389498863e-01, 9.142857142857142572e-01, 5.919619503859254728e-01], 
-[4.229242874389498863e-01, 9.163265306122448939e-01, 6.067463758249870276e-01], 
-[4.229242874389498863e-01, 9.183673469387755306e-01, 6.222485124903395226e-01], 
-[4.229242874389498863e-01, 9.204081632653061673e-01, 6.385223617849185018e-01], 
-[4.229242874389498863e-01, 9.224489795918368040e-01, 6.556275158379363255e-01], 
-[4.229242874389498863e-01, 9.244897959183673297e-01, 6.736299029570649299e-01], 
-[4.229242874389498863e-01, 9.265306122448979664e-01, 6.926026559291023066e-01], 
-[4.229242874389498863e-01, 9.285714285714286031e-01, 7.126271274994946392e-01], 
-[4.229242874389498863e-01, 9.306122448979592399e-01, 7.337940830365898837e-01], 
-[4.229242874389498863e-01, 9.326530612244897656e-01, 7.562051075974229875e-01], 
-[4.229242874389498863e-01, 9.346938775510204023e-01, 7.799742738352770655e-01], 
-[4.229242874389498863e-01, 9.367346938775510390e-01, 8.052301290694641178e-01], 
-[4.229242874389498863e-01, 9.387755102040816757e-01, 8.321180752536719849e-01], 
-[4.229242874389498863e-01, 9.408163265306123124e-01, 8.608032357420927205e-01], 
-[4.229242874389498863e-01, 9.428571428571428381e-01, 8.914739293441339418e-01], 
-[4.229242874389498863e-01, 9.448979591836734748e-01, 9.243459075441669004e-01], 
-[4.229242874389498863e-01, 9.469387755102041115e-01, 9.596675582982985286e-01], 
-[4.229242874389498863e-01, 9.489795918367347483e-01, 9.977263443313608704e-01], 
-[4.229242874389498863e-01, 9.510204081632652739e-01, 1.038856832363803218e+00], 
-[4.229242874389498863e-01, 9.530612244897959107e-01, 1.083450792555850306e+00], 
-[4.229242874389498863e-01, 9.551020408163265474e-01, 1.131970020161595425e+00], 
-[4.229242874389498863e-01, 9.571428571428571841e-01, 1.184962777496629371e+00], 
-[4.229242874389498863e-01, 9.591836734693878208e-01, 1.243085110261968440e+00], 
-[4.229242874389498863e-01, 9.612244897959183465e-01, 1.307128815395066868e+00], 
-[4.229242874389498863e-01, 9.632653061224489832e-01, 1.378058620096042741e+00], 
-[4.229242874389498863e-01, 9.653061224489796199e-01, 1.457062324865095793e+00], 
-[4.229242874389498863e-01, 9.673469387755102566e-01, 1.545619521941064001e+00], 
-[4.229242874389498863e-01, 9.693877551020407823e-01, 1.645597464455822667e+00], 
-[4.229242874389498863e-01, 9.714285714285714191e-01, 1.759387514015192444e+00], 
-[4.229242874389498863e-01, 9.734693877551020558e-01, 1.890103775886356141e+00], 
-[4.229242874389498863e-01, 9.755102040816326925e-01, 2.041879792250161252e+00], 
-[4.229242874389498863e-01, 9.775510204081632182e-01, 2.220324984349669073e+00], 
-[4.229242874389498863e-01, 9.795918367346938549e-01, 2.433251370390882240e+00], 
-[4.229242874389498863e-01, 9.816326530612244916e-01, 2.691878277113037843e+00], 
-[4.229242874389498863e-01, 9.836734693877551283e-01, 3.012928181325989385e+00], 
-[4.229242874389498863e-01, 9.857142857142857650e-01, 3.422493549492246157e+00], 
-[4.229242874389498863e-01, 9.877551020408162907e-01, 3.963713588891071726e+00], 
-[4.229242874389498863e-01, 9.897959183673469274e-01, 4.713520455312001367e+00], 
-[4.229242874389498863e-01, 9.918367346938775642e-01, 5.824088276897624539e+00], 
-[4.229242874389498863e-01, 9.938775510204082009e-01, 7.645663093168600710e+00], 
-[4.229242874389498863e-01, 9.959183673469387266e-01, 1.120998445783841824e+01], 
-[4.229242874389498863e-01, 9.979591836734693633e-01, 2.152936614103496638e+01], 
-[4.229242874389498863e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[4.641588833612781961e-01, 1.000000000000000021e-03, 3.461955063259115895e-02], 
-[4.641588833612781961e-01, 1.148922311909569708e-03, 3.458756529443896693e-02], 
-[4.641588833612781961e-01, 1.320022478803632065e-03, 3.455629257825446055e-02], 
-[4.641588833612781961e-01, 1.516603278119670137e-03, 3.452583892511373875e-02], 
-[4.641588833612781961e-01, 1.742459344546885402e-03, 3.449632686835885087e-02], 
-[4.641588833612781961e-01, 2.001950418545241171e-03, 3.446789752782235261e-02], 
-[4.641588833612781961e-01, 2.300085503203331758e-03, 3.444071351005144332e-02], 
-[4.641588833612781961e-01, 2.642619553930058204e-03, 3.441496228642772215e-02], 
-[4.641588833612781961e-01, 3.036164567398761706e-03, 3.439086013578107615e-02], 
-[4.641588833612781961e-01, 3.488317214113704091e-03, 3.436865675600192516e-02], 
-[4.641588833612781961e-01, 4.007805478313466660e-03, 3.434864067169311058e-02], 
-[4.641588833612781961e-01, 4.604657135827751671e-03, 3.433114559254620696e-02], 
-[4.641588833612781961e-01, 5.290393322046124149e-03, 3.431655791269577760e-02], 
-[4.641588833612781961e-01, 6.078250926476181683e-03, 3.430532558557729261e-02], 
-[4.641588833612781961e-01, 6.983438106813499684e-03, 3.429796866565632679e-02], 
-[4.641588833612781961e-01, 8.023427854757562983e-03, 3.429509188107292272e-02], 
-[4.641588833612781961e-01, 9.218295280327699903e-03, 3.429739969494129126e-02], 
-[4.641588833612781961e-01, 1.059110512533918171e-02, 3.430571443482620386e-02], 
-[4.641588833612781961e-01, 1.216835698628199354e-02, 3.432099822853332954e-02], 
-[4.641588833612781961e-01, 1.398049684082008047e-02, 3.434437969353351661e-02], 
-[4.641588833612781961e-01, 1.606250475199945058e-02, 3.437718660365789158e-02], 
-[4.641588833612781961e-01, 1.845457009472566828e-02, 3.442098612545319708e-02], 
-[4.641588833612781961e-01, 2.120286733852943389e-02, 3.447763471176600036e-02], 
-[4.641588833612781961e-01, 2.436044736169515681e-02, 3.454934041052055288e-02], 
-[4.641588833612781961e-01, 2.798826150195019707e-02, 3.463874126187387048e-02], 
-[4.641588833612781961e-01, 3.215633811115024138e-02, 3.474900471766124987e-02], 
-[4.641588833612781961e-01, 3.694513432520856594e-02, 3.488395477066034284e-02], 
-[4.641588833612781961e-01, 4.244708914272822542e-02, 3.504823594625250394e-02], 
-[4.641588833612781961e-01, 4.876840779169493850e-02, 3.524752681428204582e-02], 
-[4.641588833612781961e-01, 5.603111182818285713e-02, 3.548882072656223824e-02], 
-[4.641588833612781961e-01, 6.437539454049952259e-02, 3.578079885585531972e-02], 
-[4.641588833612781961e-01, 7.396232712556144451e-02, 3.613433154056302360e-02], 
-[4.641588833612781961e-01, 8.497696787531199003e-02, 3.656316042086706075e-02], 
-[4.641588833612781961e-01, 9.763193439036874088e-02, 3.708483918210681018e-02], 
-[4.641588833612781961e-01, 1.121715077759858903e-01, 3.772205047807240114e-02], 
-[4.641588833612781961e-01, 1.288763480443681220e-01, 3.850448049424314012e-02], 
-[4.641588833612781961e-01, 1.480689117455977755e-01, 3.947153802826725011e-02], 
-[4.641588833612781961e-01, 1.701196764046864207e-01, 4.067638418966959546e-02], 
-[4.641588833612781961e-01, 1.954542919161802172e-01, 4.219205407227062665e-02], 
-[4.641588833612781961e-01, 2.245617969409859638e-01, 4.412102832034581895e-02], 
-[4.641588833612781961e-01, 2.580040589080049296e-01, 4.661071566888175949e-02], 
-[4.641588833612781961e-01, 2.964266198426381838e-01, 4.987953271650299308e-02], 
-[4.641588833612781961e-01, 3.405711573811430193e-01, 5.426304610909275794e-02], 
-[4.641588833612781961e-01, 3.912898015080607528e-01, 6.030071419382801445e-02], 
-[4.641588833612781961e-01, 4.495615833752782953e-01, 6.891193846618798302e-02], 
-[4.641588833612781961e-01, 5.165113337172515529e-01, 8.179092766913015344e-02], 
-[4.641588833612781961e-01, 5.934313956619206021e-01, 1.024214951203198248e-01], 
-[4.641588833612781961e-01, 6.818065710636164178e-01, 1.392569983574949155e-01], 
-[4.641588833612781961e-01, 7.833427819015473803e-01, 2.194985393867782131e-01], 
-[4.641588833612781961e-01, 9.000000000000000222e-01, 5.081064172201246176e-01], 
-[4.641588833612781961e-01, 9.020408163265306589e-01, 5.190887126503523907e-01], 
-[4.641588833612781961e-01, 9.040816326530612956e-01, 5.305252426155817602e-01], 
-[4.641588833612781961e-01, 9.061224489795918213e-01, 5.424449795015766629e-01], 
-[4.641588833612781961e-01, 9.081632653061224580e-01, 5.548794285036853235e-01], 
-[4.641588833612781961e-01, 9.102040816326530948e-01, 5.678629116193496529e-01], 
-[4.641588833612781961e-01, 9.122448979591837315e-01, 5.814328908244670302e-01], 
-[4.641588833612781961e-01, 9.142857142857142572e-01, 5.956303369010500504e-01], 
-[4.641588833612781961e-01, 9.163265306122448939e-01, 6.105001516346870716e-01], 
-[4.641588833612781961e-01, 9.183673469387755306e-01, 6.260916526308937247e-01], 
-[4.641588833612781961e-01, 9.204081632653061673e-01, 6.424591318802398421e-01], 
-[4.641588833612781961e-01, 9.224489795918368040e-01, 6.596625015251487145e-01], 
-[4.641588833612781961e-01, 9.244897959183673297e-01, 6.777680431649126813e-01], 
-[4.641588833612781961e-01, 9.265306122448979664e-01, 6.968492806343299373e-01], 
-[4.641588833612781961e-01, 9.285714285714286031e-01, 7.169880007084610263e-01], 
-[4.641588833612781961e-01, 9.306122448979592399e-01, 7.382754518896501583e-01], 
-[4.641588833612781961e-01, 9.326530612244897656e-01, 7.608137586795522544e-01], 
-[4.641588833612781961e-01, 9.346938775510204023e-01, 7.847175980078502366e-01], 
-[4.641588833612781961e-01, 9.367346938775510390e-01, 8.101161964280427785e-01], 
-[4.641588833612781961e-01, 9.387755102040816757e-01, 8.371557221822457651e-01], 
-[4.641588833612781961e-01, 9.408163265306123124e-01, 8.660021664985512180e-01], 
-[4.641588833612781961e-01, 9.428571428571428381e-01, 8.968448352058975281e-01], 
-[4.641588833612781961e-01, 9.448979591836734748e-01, 9.299006073093322167e-01], 
-[4.641588833612781961e-01, 9.469387755102041115e-01, 9.654191649348242699e-01], 
-[4.641588833612781961e-01, 9.489795918367347483e-01, 1.003689463876132670e+00], 
-[4.641588833612781961e-01, 9.510204081632652739e-01, 1.045047802909653045e+00], 
-[4.641588833612781961e-01, 9.530612244897959107e-01, 1.089887973491424855e+00], 
-[4.641588833612781961e-01, 9.551020408163265474e-01, 1.138674144983149006e+00], 
-[4.641588833612781961e-01, 9.571428571428571841e-01, 1.191957387839669202e+00], 
-[4.641588833612781961e-01, 9.591836734693878208e-01, 1.250397094821990018e+00], 
-[4.641588833612781961e-01, 9.612244897959183465e-01, 1.314789085905386568e+00], 
-[4.641588833612781961e-01, 9.632653061224489832e-01, 1.386102968719651773e+00], 
-[4.641588833612781961e-01, 9.653061224489796199e-01, 1.465532525148607101e+00], 
-[4.641588833612781961e-01, 9.673469387755102566e-01, 1.554564761955415264e+00], 
-[4.641588833612781961e-01, 9.693877551020407823e-01, 1.655076241007623405e+00], 
-[4.641588833612781961e-01, 9.714285714285714191e-01, 1.769470179517429020e+00], 
-[4.641588833612781961e-01, 9.734693877551020558e-01, 1.900876029814293489e+00], 
-[4.641588833612781961e-01, 9.755102040816326925e-01, 2.053447574648215923e+00], 
-[4.641588833612781961e-01, 9.775510204081632182e-01, 2.232821511679901949e+00], 
-[4.641588833612781961e-01, 9.795918367346938549e-01, 2.446847557107135973e+00], 
-[4.641588833612781961e-01, 9.816326530612244916e-01, 2.706798724433779668e+00], 
-[4.641588833612781961e-01, 9.836734693877551283e-01, 3.029476764356741292e+00], 
-[4.641588833612781961e-01, 9.857142857142857650e-01, 3.441096535164109405e+00], 
-[4.641588833612781961e-01, 9.877551020408162907e-01, 3.984997158875082768e+00], 
-[4.641588833612781961e-01, 9.897959183673469274e-01, 4.738462282626175970e+00], 
-[4.641588833612781961e-01, 9.918367346938775642e-01, 5.854349484037602913e+00], 
-[4.641588833612781961e-01, 9.938775510204082009e-01, 7.684444165121758985e+00], 
-[4.641588833612781961e-01, 9.959183673469387266e-01, 1.126488831078836839e+01], 
-[4.641588833612781961e-01, 9.979591836734693633e-01, 2.162837180003794302e+01], 
-[4.641588833612781961e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[5.094138014816380622e-01, 1.000000000000000021e-03, 3.488529365485149025e-02], 
-[5.094138014816380622e-01, 1.148922311909569708e-03, 3.485280647041827384e-02], 
-[5.094138014816380622e-01, 1.320022478803632065e-03, 3.482103694396127685e-02], 
-[5.094138014816380622e-01, 1.516603278119670137e-03, 3.479009226342977268e-02], 
-[5.094138014816380622e-01, 1.742459344546885402e-03, 3.476009582117255831e-02], 
-[5.094138014816380622e-01, 2.001950418545241171e-03, 3.473118972543712268e-02], 
-[5.094138014816380622e-01, 2.300085503203331758e-03, 3.470353772065834508e-02], 
-[5.094138014816380622e-01, 2.642619553930058204e-03, 3.467732858893449177e-02], 
-[5.094138014816380622e-01, 3.036164567398761706e-03, 3.465278011988037060e-02], 
-[5.094138014816380622e-01, 3.488317214113704091e-03, 3.463014375408177137e-02], 
-[5.094138014816380622e-01, 4.007805478313466660e-03, 3.460971002805411645e-02], 
-[5.094138014816380622e-01, 4.604657135827751671e-03, 3.459181497646363068e-02], 
-[5.094138014816380622e-01, 5.290393322046124149e-03, 3.457684768315474194e-02], 
-[5.094138014816380622e-01, 6.078250926476181683e-03, 3.456525921712008675e-02], 
-[5.094138014816380622e-01, 6.983438106813499684e-03, 3.455757324677192349e-02], 
-[5.094138014816380622e-01, 8.023427854757562983e-03, 3.455439869904502331e-02], 
-[5.094138014816380622e-01, 9.218295280327699903e-03, 3.455644492419863989e-02], 
-[5.094138014816380622e-01, 1.059110512533918171e-02, 3.456453994978253563e-02], 
-[5.094138014816380622e-01, 1.216835698628199354e-02, 3.457965256694298106e-02], 
-[5.094138014816380622e-01, 1.398049684082008047e-02, 3.460291920282140138e-02], 
-[5.094138014816380622e-01, 1.606250475199945058e-02, 3.463567681099830042e-02], 
-[5.094138014816380622e-01, 1.845457009472566828e-02, 3.467950338316751896e-02], 
-[5.094138014816380622e-01, 2.120286733852943389e-02, 3.473626818373943409e-02], 
-[5.094138014816380622e-01, 2.436044736169515681e-02, 3.480819448396925420e-02], 
-[5.094138014816380622e-01, 2.798826150195019707e-02, 3.489793849355633110e-02], 
-[5.094138014816380622e-01, 3.215633811115024138e-02, 3.500868945681451239e-02], 
-[5.094138014816380622e-01, 3.694513432520856594e-02, 3.514429764581487176e-02], 
-[5.094138014816380622e-01, 4.244708914272822542e-02, 3.530943946433526270e-02], 
-[5.094138014816380622e-01, 4.876840779169493850e-02, 3.550983240489959808e-02], 
-[5.094138014816380622e-01, 5.603111182818285713e-02, 3.575251768218096898e-02], 
-[5.094138014816380622e-01, 6.437539454049952259e-02, 3.604623578495390335e-02], 
-[5.094138014816380622e-01, 7.396232712556144451e-02, 3.640193118890326651e-02], 
-[5.094138014816380622e-01, 8.497696787531199003e-02, 3.683343906187429295e-02], 
-[5.094138014816380622e-01, 9.763193439036874088e-02, 3.735843228821428275e-02], 
-[5.094138014816380622e-01, 1.121715077759858903e-01, 3.799974715374233869e-02], 
-[5.094138014816380622e-01, 1.288763480443681220e-01, 3.878727033312201478e-02], 
-[5.094138014816380622e-01, 1.480689117455977755e-01, 3.976067591701726300e-02], 
-[5.094138014816380622e-01, 1.701196764046864207e-01, 4.097348158911709448e-02], 
-[5.094138014816380622e-01, 1.954542919161802172e-01, 4.249921032415251987e-02], 
-[5.094138014816380622e-01, 2.245617969409859638e-01, 4.444102420186606117e-02], 
-[5.094138014816380622e-01, 2.580040589080049296e-01, 4.694730704807882626e-02], 
-[5.094138014816380622e-01, 2.964266198426381838e-01, 5.023791174066549736e-02], 
-[5.094138014816380622e-01, 3.405711573811430193e-01, 5.465059669777611040e-02], 
-[5.094138014816380622e-01, 3.912898015080607528e-01, 6.072831639600723141e-02], 
-[5.094138014816380622e-01, 4.495615833752782953e-01, 6.939637678254091668e-02], 
-[5.094138014816380622e-01, 5.165113337172515529e-01, 8.235974975175111568e-02], 
-[5.094138014816380622e-01, 5.934313956619206021e-01, 1.031240902204563770e-01], 
-[5.094138014816380622e-01, 6.818065710636164178e-01, 1.401948659092676908e-01], 
-[5.094138014816380622e-01, 7.833427819015473803e-01, 2.209369609984072613e-01], 
-[5.094138014816380622e-01, 9.000000000000000222e-01, 5.112638117404236793e-01], 
-[5.094138014816380622e-01, 9.020408163265306589e-01, 5.223097716904107068e-01], 
-[5.094138014816380622e-01, 9.040816326530612956e-01, 5.338124917146158666e-01], 
-[5.094138014816380622e-01, 9.061224489795918213e-01, 5.458011007280747506e-01], 
-[5.094138014816380622e-01, 9.081632653061224580e-01, 5.583072738423362491e-01], 
-[5.094138014816380622e-01, 9.102040816326530948e-01, 5.713655178322529782e-01], 
-[5.094138014816380622e-01, 9.122448979591837315e-01, 5.850134959869429663e-01], 
-[5.094138014816380622e-01, 9.142857142857142572e-01, 5.992923988449998518e-01], 
-[5.094138014816380622e-01, 9.163265306122448939e-01, 6.142473685712912523e-01], 
-[5.094138014816380622e-01, 9.183673469387755306e-01, 6.299279862709290523e-01], 
-[5.094138014816380622e-01, 9.204081632653061673e-01, 6.463888334260774471e-01], 
-[5.094138014816380622e-01, 9.224489795918368040e-01, 6.636901409758313442e-01], 
-[5.094138014816380622e-01, 9.244897959183673297e-01, 6.818985424572592269e-01], 
-[5.094138014816380622e-01, 9.265306122448979664e-01, 7.010879512423354720e-01], 
-[5.094138014816380622e-01, 9.285714285714286031e-01, 7.213405864448031446e-01], 
-[5.094138014816380622e-01, 9.306122448979592399e-01, 7.427481778026536752e-01], 
-[5.094138014816380622e-01, 9.326530612244897656e-01, 7.654133871239932052e-01], 
-[5.094138014816380622e-01, 9.346938775510204023e-01, 7.894514931983397377e-01], 
-[5.094138014816380622e-01, 9.367346938775510390e-01, 8.149923990720924216e-01], 
-[5.094138014816380622e-01, 9.387755102040816757e-01, 8.421830361541247090e-01], 
-[5.094138014816380622e-01, 9.408163265306123124e-01, 8.711902599768182043e-01], 
-[5.094138014816380622e-01, 9.428571428571428381e-01, 9.022043592887754038e-01], 
-[5.094138014816380622e-01, 9.448979591836734748e-01, 9.354433358845759550e-01], 
-[5.094138014816380622e-01, 9.469387755102041115e-01, 9.711581605727590549e-01], 
-[5.094138014816380622e-01, 9.489795918367347483e-01, 1.009639275817087789e+00], 
-[5.094138014816380622e-01, 9.510204081632652739e-01, 1.051224704944135668e+00], 
-[5.094138014816380622e-01, 9.530612244897959107e-01, 1.096310251845912909e+00], 
-[5.094138014816380622e-01, 9.551020408163265474e-01, 1.145362449461704291e+00], 
-[5.094138014816380622e-01, 9.571428571428571841e-01, 1.198935163777090862e+00], 
-[5.094138014816380622e-01, 9.591836734693878208e-01, 1.257691119392694734e+00], 
-[5.094138014816380622e-01, 9.612244897959183465e-01, 1.322430140784129904e+00], 
-[5.094138014816380622e-01, 9.632653061224489832e-01, 1.394126693211160894e+00], 
-[5.094138014816380622e-01, 9.653061224489796199e-01, 1.473980511593941500e+00], 
-[5.094138014816380622e-01, 9.673469387755102566e-01, 1.563485981548165871e+00], 
-[5.094138014816380622e-01, 9.693877551020407823e-01, 1.664528928179225709e+00], 
-[5.094138014816380622e-01, 9.714285714285714191e-01, 1.779524365387555207e+00], 
-[5.094138014816380622e-01, 9.734693877551020558e-01, 1.911617014941817683e+00], 
-[5.094138014816380622e-01, 9.755102040816326925e-01, 2.064980795856735885e+00], 
-[5.094138014816380622e-01, 9.775510204081632182e-01, 2.245279538817412934e+00], 
-[5.094138014816380622e-01, 9.795918367346938549e-01, 2.460400455543954479e+00], 
-[5.094138014816380622e-01, 9.816326530612244916e-01, 2.721669951207609017e+00], 
-[5.094138014816380622e-01, 9.836734693877551283e-01, 3.045968603506084005e+00], 
-[5.094138014816380622e-01, 9.857142857142857650e-01, 3.459632953118386922e+00], 
-[5.094138014816380622e-01, 9.877551020408162907e-01, 4.006200841378518618e+00], 
-[5.094138014816380622e-01, 9.897959183673469274e-01, 4.763305229148338427e+00], 
-[5.094138014816380622e-01, 9.918367346938775642e-01, 5.884482730293235875e+00], 
-[5.094138014816380622e-01, 9.938775510204082009e-01, 7.723047656007812733e+00], 
-[5.094138014816380622e-01, 9.959183673469387266e-01, 1.131951249936038550e+01], 
-[5.094138014816380622e-01, 9.979591836734693633e-01, 2.172677986485356527e+01], 
-[5.094138014816380622e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[5.590810182512228055e-01, 1.000000000000000021e-03, 3.515139657440585763e-02], 
-[5.590810182512228055e-01, 1.148922311909569708e-03, 3.511840335384871364e-02], 
-[5.590810182512228055e-01, 1.320022478803632065e-03, 3.508613282803427214e-02], 
-[5.590810182512228055e-01, 1.516603278119670137e-03, 3.505469293182715551e-02], 
-[5.590810182512228055e-01, 1.742459344546885402e-03, 3.502420791662139155e-02], 
-[5.590810182512228055e-01, 2.001950418545241171e-03, 3.499482087911158501e-02], 
-[5.590810182512228055e-01, 2.300085503203331758e-03, 3.496669670164388732e-02], 
-[5.590810182512228055e-01, 2.642619553930058204e-03, 3.494002547704487538e-02], 
-[5.590810182512228055e-01, 3.036164567398761706e-03, 3.491502650570994098e-02], 
-[5.590810182512228055e-01, 3.488317214113704091e-03, 3.489195297089470182e-02], 
-[5.590810182512228055e-01, 4.007805478313466660e-03, 3.487109742097437015e-02], 
-[5.590810182512228055e-01, 4.604657135827751671e-03, 3.485279821550191226e-02], 
-[5.590810182512228055e-01, 5.290393322046124149e-03, 3.483744712789887954e-02], 
-[5.590810182512228055e-01, 6.078250926476181683e-03, 3.482549834252589988e-02], 
-[5.590810182512228055e-01, 6.983438106813499684e-03, 3.481747914148128342e-02], 
-[5.590810182512228055e-01, 8.023427854757562983e-03, 3.481400265014423373e-02], 
-[5.590810182512228055e-01, 9.218295280327699903e-03, 3.481578310545598715e-02], 
-[5.590810182512228055e-01, 1.059110512533918171e-02, 3.482365423434688467e-02], 
-[5.590810182512228055e-01, 1.216835698628199354e-02, 3.483859149052125070e-02], 
-[5.590810182512228055e-01, 1.398049684082008047e-02, 3.486173910978445506e-02], 
-[5.590810182512228055e-01, 1.606250475199945058e-02, 3.489444322417593197e-02], 
-[5.590810182512228055e-01, 1.845457009472566828e-02, 3.493829264888572567e-02], 
-[5.590810182512228055e-01, 2.120286733852943389e-02, 3.499516945777632337e-02], 
-[5.590810182512228055e-01, 2.436044736169515681e-02, 3.506731214272947733e-02], 
-[5.590810182512228055e-01, 2.798826150195019707e-02, 3.515739507951392423e-02], 
-[5.590810182512228055e-01, 3.215633811115024138e-02, 3.526862930044415145e-02], 
-[5.590810182512228055e-01, 3.694513432520856594e-02, 3.540489135108149110e-02], 
-[5.590810182512228055e-01, 4.244708914272822542e-02, 3.557088950602430022e-02], 
-[5.590810182512228055e-01, 4.876840779169493850e-02, 3.577238017052381674e-02], 
-[5.590810182512228055e-01, 5.603111182818285713e-02, 3.601645240890854333e-02], 
-[5.590810182512228055e-01, 6.437539454049952259e-02, 3.631190600828305276e-02], 
-[5.590810182512228055e-01, 7.396232712556144451e-02, 3.666975955767867029e-02], 
-[5.590810182512228055e-01, 8.497696787531199003e-02, 3.710394171981885175e-02], 
-[5.590810182512228055e-01, 9.763193439036874088e-02, 3.763224453257998925e-02], 
-[5.590810182512228055e-01, 1.121715077759858903e-01, 3.827765784985037029e-02], 
-[5.590810182512228055e-01, 1.288763480443681220e-01, 3.907026874417550422e-02], 
-[5.590810182512228055e-01, 1.480689117455977755e-01, 4.005001646676036031e-02], 
-[5.590810182512228055e-01, 1.701196764046864207e-01, 4.127077507975178416e-02], 
-[5.590810182512228055e-01, 1.954542919161802172e-01, 4.280655514377891546e-02], 
-[5.590810182512228055e-01, 2.245617969409859638e-01, 4.476119971899350514e-02], 
-[5.590810182512228055e-01, 2.580040589080049296e-01, 4.728406700110208277e-02], 
-[5.590810182512228055e-01, 2.964266198426381838e-01, 5.059644496818028331e-02], 
-[5.590810182512228055e-01, 3.405711573811430193e-01, 5.503828180651899188e-02], 
-[5.590810182512228055e-01, 3.912898015080607528e-01, 6.115602454734456184e-02], 
-[5.590810182512228055e-01, 4.495615833752782953e-01, 6.988087680486604336e-02], 
-[5.590810182512228055e-01, 5.165113337172515529e-01, 8.292855963360135085e-02], 
-[5.590810182512228055e-01, 5.934313956619206021e-01, 1.038265371235690127e-01], 
-[5.590810182512228055e-01, 6.818065710636164178e-01, 1.411322974962611332e-01], 
-[5.590810182512228055e-01, 7.833427819015473803e-01, 2.223741712194937936e-01], 
-[5.590810182512228055e-01, 9.000000000000000222e-01, 5.144162247112794573e-01], 
-[5.590810182512228055e-01, 9.020408163265306589e-01, 5.255256852214851282e-01], 
-[5.590810182512228055e-01, 9.040816326530612956e-01, 5.370944233245882327e-01], 
-[5.590810182512228055e-01, 9.061224489795918213e-01, 5.491517239030179187e-01], 
-[5.590810182512228055e-01, 9.081632653061224580e-01, 5.617294313703368180e-01], 
-[5.590810182512228055e-01, 9.102040816326530948e-01, 5.748622366061741928e-01], 
-[5.590810182512228055e-01, 9.122448979591837315e-01, 5.885880034747634770e-01], 
-[5.590810182512228055e-01, 9.142857142857142572e-01, 6.029481414596431499e-01], 
-[5.590810182512228055e-01, 9.163265306122448939e-01, 6.179880322105379964e-01], 
-[5.590810182512228055e-01, 9.183673469387755306e-01, 6.337575193442508414e-01], 
-[5.590810182512228055e-01, 9.204081632653061673e-01, 6.503114727407917073e-01], 
-[5.590810182512228055e-01, 9.224489795918368040e-01, 6.677104409219517533e-01], 
-[5.590810182512228055e-01, 9.244897959183673297e-01, 6.860214080116164848e-01], 
-[5.590810182512228055e-01, 9.265306122448979664e-01, 7.053186754113625057e-01], 
-[5.590810182512228055e-01, 9.285714285714286031e-01, 7.256848928863585124e-01], 
-[5.590810182512228055e-01, 9.306122448979592399e-01, 7.472122695160626771e-01], 
-[5.590810182512228055e-01, 9.326530612244897656e-01, 7.700040022816239116e-01], 
-[5.590810182512228055e-01, 9.346938775510204023e-01, 7.941759694212141563e-01], 
-[5.590810182512228055e-01, 9.367346938775510390e-01, 8.198587477391043876e-01], 
-[5.590810182512228055e-01, 9.387755102040816757e-01, 8.472000286964014304e-01], 
-[5.590810182512228055e-01, 9.408163265306123124e-01, 8.763675285684486838e-01], 
-[5.590810182512228055e-01, 9.428571428571428381e-01, 9.075525149332740460e-01], 
-[5.590810182512228055e-01, 9.448979591836734748e-01, 9.409741076550790506e-01], 
-[5.590810182512228055e-01, 9.469387755102041115e-01, 9.768845607508783724e-01], 
-[5.590810182512228055e-01, 9.489795918367347483e-01, 1.015575796971093681e+00], 
-[5.590810182512228055e-01, 9.510204081632652739e-01, 1.057387556705216003e+00], 
-[5.590810182512228055e-01, 9.530612244897959107e-01, 1.102717647443512750e+00], 
-[5.590810182512228055e-01, 9.551020408163265474e-01, 1.152034955199491062e+00], 
-[5.590810182512228055e-01, 9.571428571428571841e-01, 1.205896128913317877e+00], 
-[5.590810182512228055e-01, 9.591836734693878208e-01, 1.264967209844492402e+00], 
-[5.590810182512228055e-01, 9.612244897959183465e-01, 1.330052008480462566e+00], 
-[5.590810182512228055e-01, 9.632653061224489832e-01, 1.402129824972423666e+00], 
-[5.590810182512228055e-01, 9.653061224489796199e-01, 1.482406319006810858e+00], 
-[5.590810182512228055e-01, 9.673469387755102566e-01, 1.572383219478864058e+00], 
-[5.590810182512228055e-01, 9.693877551020407823e-01, 1.673955569362160389e+00], 
-[5.590810182512228055e-01, 9.714285714285714191e-01, 1.789550120496186336e+00], 
-[5.590810182512228055e-01, 9.734693877551020558e-01, 1.922326786692492906e+00], 
-[5.590810182512228055e-01, 9.755102040816326925e-01, 2.076479519236816174e+00], 
-[5.590810182512228055e-01, 9.775510204081632182e-01, 2.257699138881507306e+00], 
-[5.590810182512228055e-01, 9.795918367346938549e-01, 2.473910151028946736e+00], 
-[5.590810182512228055e-01, 9.816326530612244916e-01, 2.736492058359684343e+00], 
-[5.590810182512228055e-01, 9.836734693877551283e-01, 3.062403820144645294e+00], 
-[5.590810182512228055e-01, 9.857142857142857650e-01, 3.478102952399389824e+00], 
-[5.590810182512228055e-01, 9.877551020408162907e-01, 4.027324824482041876e+00], 
-[5.590810182512228055e-01, 9.897959183673469274e-01, 4.788049541150132704e+00], 
-[5.590810182512228055e-01, 9.918367346938775642e-01, 5.914488355701699618e+00], 
-[5.590810182512228055e-01, 9.938775510204082009e-01, 7.761474075946683371e+00], 
-[5.590810182512228055e-01, 9.959183673469387266e-01, 1.137385791206332719e+01], 
-[5.590810182512228055e-01, 9.979591836734693633e-01, 2.182459254787577052e+01], 
-[5.590810182512228055e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[6.135907273413175878e-01, 1.000000000000000021e-03, 3.541785963805273163e-02], 
-[6.135907273413175878e-01, 1.148922311909569708e-03, 3.538435618456967774e-02], 
-[6.135907273413175878e-01, 1.320022478803632065e-03, 3.535158046334523074e-02], 
-[6.135907273413175878e-01, 1.516603278119670137e-03, 3.531964115620037786e-02], 
-[6.135907273413175878e-01, 1.742459344546885402e-03, 3.528866337361129951e-02], 
-[6.135907273413175878e-01, 2.001950418545241171e-03, 3.525879120075041395e-02], 
-[6.135907273413175878e-01, 2.300085503203331758e-03, 3.523019065789696758e-02], 
-[6.135907273413175878e-01, 2.642619553930058204e-03, 3.520305314861534723e-02], 
-[6.135907273413175878e-01, 3.036164567398761706e-03, 3.517759948407477022e-02], 
-[6.135907273413175878e-01, 3.488317214113704091e-03, 3.515408459017241999e-02], 
-[6.135907273413175878e-01, 4.007805478313466660e-03, 3.513280302708737812e-02], 
-[6.135907273413175878e-01, 4.604657135827751671e-03, 3.511409547916774510e-02], 
-[6.135907273413175878e-01, 5.290393322046124149e-03, 3.509835640927541633e-02], 
-[6.135907273413175878e-01, 6.078250926476181683e-03, 3.508604311694494410e-02], 
-[6.135907273413175878e-01, 6.983438106813499684e-03, 3.507768649769451436e-02], 
-[6.135907273413175878e-01, 8.023427854757562983e-03, 3.507390387499113860e-02], 
-[6.135907273413175878e-01, 9.218295280327699903e-03, 3.507541437198754414e-02], 
-[6.135907273413175878e-01, 1.059110512533918171e-02, 3.508305741438160624e-02], 
-[6.135907273413175878e-01, 1.216835698628199354e-02, 3.509781511764335088e-02], 
-[6.135907273413175878e-01, 1.398049684082008047e-02, 3.512083952522374042e-02], 
-[6.135907273413175878e-01, 1.606250475199945058e-02, 3.515348594631721724e-02], 
-[6.135907273413175878e-01, 1.845457009472566828e-02, 3.519735401794323731e-02], 
-[6.135907273413175878e-01, 2.120286733852943389e-02, 3.525433862128619922e-02], 
-[6.135907273413175878e-01, 2.436044736169515681e-02, 3.532669346612801742e-02], 
-[6.135907273413175878e-01, 2.798826150195019707e-02, 3.541711109080794562e-02], 
-[6.135907273413175878e-01, 3.215633811115024138e-02, 3.552882431113243977e-02], 
-[6.135907273413175878e-01, 3.694513432520856594e-02, 3.566573594031090949e-02], 
-[6.135907273413175878e-01, 4.244708914272822542e-02, 3.583258611614918016e-02], 
-[6.135907273413175878e-01, 4.876840779169493850e-02, 3.603517014661361539e-02], 
-[6.135907273413175878e-01, 5.603111182818285713e-02, 3.628062493242181774e-02], 
-[6.135907273413175878e-01, 6.437539454049952259e-02, 3.657780954124797285e-02], 
-[6.135907273413175878e-01, 7.396232712556144451e-02, 3.693781665143722193e-02], 
-[6.135907273413175878e-01, 8.497696787531199003e-02, 3.737466838768756239e-02], 
-[6.135907273413175878e-01, 9.763193439036874088e-02, 3.790627589577838519e-02], 
-[6.135907273413175878e-01, 1.121715077759858903e-01, 3.855578253352288237e-02], 
-[6.135907273413175878e-01, 1.288763480443681220e-01, 3.935347567981341277e-02], 
-[6.135907273413175878e-01, 1.480689117455977755e-01, 4.033955961362476611e-02], 
-[6.135907273413175878e-01, 1.701196764046864207e-01, 4.156826457947475351e-02], 
-[6.135907273413175878e-01, 1.954542919161802172e-01, 4.311408842838587718e-02], 
-[6.135907273413175878e-01, 2.245617969409859638e-01, 4.508155474521966660e-02], 
-[6.135907273413175878e-01, 2.580040589080049296e-01, 4.762099537377798009e-02], 
-[6.135907273413175878e-01, 2.964266198426381838e-01, 5.095513221218615774e-02], 
-[6.135907273413175878e-01, 3.405711573811430193e-01, 5.542610120932320306e-02], 
-[6.135907273413175878e-01, 3.912898015080607528e-01, 6.158383837447516107e-02], 
-[6.135907273413175878e-01, 4.495615833752782953e-01, 7.036543820229348989e-02], 
-[6.135907273413175878e-01, 5.165113337172515529e-01, 8.349735691528484272e-02], 
-[6.135907273413175878e-01, 5.934313956619206021e-01, 1.045288353562158212e-01], 
-[6.135907273413175878e-01, 6.818065710636164178e-01, 1.420692926041435822e-01], 
-[6.135907273413175878e-01, 7.833427819015473803e-01, 2.238101697818137836e-01], 
-[6.135907273413175878e-01, 9.000000000000000222e-01, 5.175636595693434705e-01], 
-[6.135907273413175878e-01, 9.020408163265306589e-01, 5.287364568917158891e-01], 
-[6.135907273413175878e-01, 9.040816326530612956e-01, 5.403710413186407768e-01], 
-[6.135907273413175878e-01, 9.061224489795918213e-01, 5.524968531391560855e-01], 
-[6.135907273413175878e-01, 9.081632653061224580e-01, 5.651459054558694017e-01], 
-[6.135907273413175878e-01, 9.102040816326530948e-01, 5.783530725818923912e-01], 
-[6.135907273413175878e-01, 9.122448979591837315e-01, 5.921564182199509085e-01], 
-[6.135907273413175878e-01, 9.142857142857142572e-01, 6.065975699885438610e-01], 
-[6.135907273413175878e-01, 9.163265306122448939e-01, 6.217221481296597574e-01], 
-[6.135907273413175878e-01, 9.183673469387755306e-01, 6.375802577859377429e-01], 
-[6.135907273413175878e-01, 9.204081632653061673e-01, 6.542270561437674159e-01], 
-[6.135907273413175878e-01, 9.224489795918368040e-01, 6.717234080962268816e-01], 
-[6.135907273413175878e-01, 9.244897959183673297e-01, 6.901366470059318026e-01], 
-[6.135907273413175878e-01, 9.265306122448979664e-01, 7.095414607997361234e-01], 
-[6.135907273413175878e-01, 9.285714285714286031e-01, 7.300209282106462361e-01], 
-[6.135907273413175878e-01, 9.306122448979592399e-01, 7.516677357695724648e-01], 
-[6.135907273413175878e-01, 9.326530612244897656e-01, 7.745856135020294797e-01], 
-[6.135907273413175878e-01, 9.346938775510204023e-01, 7.988910366890957793e-01], 
-[6.135907273413175878e-01, 9.367346938775510390e-01, 8.247152531640732365e-01], 
-[6.135907273413175878e-01, 9.387755102040816757e-01, 8.522067113329383492e-01], 
-[6.135907273413175878e-01, 9.408163265306123124e-01, 8.815339846609371310e-01], 
-[6.135907273413175878e-01, 9.428571428571428381e-01, 9.128893154748901617e-01], 
-[6.135907273413175878e-01, 9.448979591836734748e-01, 9.464929369999341979e-01], 
-[6.135907273413175878e-01, 9.469387755102041115e-01, 9.825983810006356789e-01], 
-[6.135907273413175878e-01, 9.489795918367347483e-01, 1.021499044146281454e+00], 
-[6.135907273413175878e-01, 9.510204081632652739e-01, 1.063536376420494145e+00], 
-[6.135907273413175878e-01, 9.530612244897959107e-01, 1.109110180096180898e+00], 
-[6.135907273413175878e-01, 9.551020408163265474e-01, 1.158691683784320414e+00], 
-[6.135907273413175878e-01, 9.571428571428571841e-01, 1.212840306835822890e+00], 
-[6.135907273413175878e-01, 9.591836734693878208e-01, 1.272225392027875879e+00], 
-[6.135907273413175878e-01, 9.612244897959183465e-01, 1.337654717420146966e+00], 
-[6.135907273413175878e-01, 9.632653061224489832e-01, 1.410112395377757455e+00], 
-[6.135907273413175878e-01, 9.653061224489796199e-01, 1.490809982160468783e+00], 
-[6.135907273413175878e-01, 9.673469387755102566e-01, 1.581256514468678986e+00], 
-[6.135907273413175878e-01, 9.693877551020407823e-01, 1.683356207902403368e+00], 
-[6.135907273413175878e-01, 9.714285714285714191e-01, 1.799547493659590991e+00], 
-[6.135907273413175878e-01, 9.734693877551020558e-01, 1.933005400424632869e+00], 
-[6.135907273413175878e-01, 9.755102040816326925e-01, 2.087943808070606533e+00], 
-[6.135907273413175878e-01, 9.775510204081632182e-01, 2.270080384895051484e+00], 
-[6.135907273413175878e-01, 9.795918367346938549e-01, 2.487376728770517964e+00], 
-[6.135907273413175878e-01, 9.816326530612244916e-01, 2.751265146665662797e+00], 
-[6.135907273413175878e-01, 9.836734693877551283e-01, 3.078782535452084801e+00], 
-[6.135907273413175878e-01, 9.857142857142857650e-01, 3.496506681801691219e+00], 
-[6.135907273413175878e-01, 9.877551020408162907e-01, 4.048369295929472145e+00], 
-[6.135907273413175878e-01, 9.897959183673469274e-01, 4.812695464429234349e+00], 
-[6.135907273413175878e-01, 9.918367346938775642e-01, 5.944366699591377312e+00], 
-[6.135907273413175878e-01, 9.938775510204082009e-01, 7.799723933891980820e+00], 
-[6.135907273413175878e-01, 9.959183673469387266e-01, 1.142792543512721792e+01], 
-[6.135907273413175878e-01, 9.979591836734693633e-01, 2.192181205479424477e+01], 
-[6.135907273413175878e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[6.734150657750828106e-01, 1.000000000000000021e-03, 3.568468309266112359e-02], 
-[6.734150657750828106e-01, 1.148922311909569708e-03, 3.565066520248701826e-02], 
-[6.734150657750828106e-01, 1.320022478803632065e-03, 3.561738008282833157e-02], 
-[6.734150657750828106e-01, 1.516603278119670137e-03, 3.558493716250213379e-02], 
-[6.734150657750828106e-01, 1.742459344546885402e-03, 3.555346241110240307e-02], 
-[6.734150657750828106e-01, 2.001950418545241171e-03, 3.552310090230844514e-02], 
-[6.734150657750828106e-01, 2.300085503203331758e-03, 3.549401979435248822e-02], 
-[6.734150657750828106e-01, 2.642619553930058204e-03, 3.546641180154427170e-02], 
-[6.734150657750828106e-01, 3.036164567398761706e-03, 3.544049924581767208e-02], 
-[6.734150657750828106e-01, 3.488317214113704091e-03, 3.541653879568037316e-02], 
-[6.734150657750828106e-01, 4.007805478313466660e-03, 3.539482702305628281e-02], 
-[6.734150657750828106e-01, 4.604657135827751671e-03, 3.537570693699342711e-02], 
-[6.734150657750828106e-01, 5.290393322046124149e-03, 3.535957568965307496e-02], 
-[6.734150657750828106e-01, 6.078250926476181683e-03, 3.534689369554482735e-02], 
-[6.734150657750828106e-01, 6.983438106813499684e-03, 3.533819546333513695e-02], 
-[6.734150657750828106e-01, 8.023427854757562983e-03, 3.533410251421564147e-02], 
-[6.734150657750828106e-01, 9.218295280327699903e-03, 3.533533885707276778e-02], 
-[6.734150657750828106e-01, 1.059110512533918171e-02, 3.534274961575034624e-02], 
-[6.734150657750828106e-01, 1.216835698628199354e-02, 3.535732356668173926e-02], 
-[6.734150657750828106e-01, 1.398049684082008047e-02, 3.538022055993357562e-02], 
-[6.734150657750828106e-01, 1.606250475199945058e-02, 3.541280508053787357e-02], 
-[6.734150657750828106e-01, 1.845457009472566828e-02, 3.545668758566088846e-02], 
-[6.734150657750828106e-01, 2.120286733852943389e-02, 3.551377576166010741e-02], 
-[6.734150657750828106e-01, 2.436044736169515681e-02, 3.558633853346935411e-02], 
-[6.734150657750828106e-01, 2.798826150195019707e-02, 3.567708659847364239e-02], 
-[6.734150657750828106e-01, 3.215633811115024138e-02, 3.578927455143194464e-02], 
-[6.734150657750828106e-01, 3.694513432520856594e-02, 3.592683146732412319e-02], 
-[6.734150657750828106e-01, 4.244708914272822542e-02, 3.609452933950282882e-02], 
-[6.734150657750828106e-01, 4.876840779169493850e-02, 3.629820236858802285e-02], 
-[6.734150657750828106e-01, 5.603111182818285713e-02, 3.654503527835480797e-02], 
-[6.734150657750828106e-01, 6.437539454049952259e-02, 3.684394639920827996e-02], 
-[6.734150657750828106e-01, 7.396232712556144451e-02, 3.720610247467902310e-02], 
-[6.734150657750828106e-01, 8.497696787531199003e-02, 3.764561905841755374e-02], 
-[6.734150657750828106e-01, 9.763193439036874088e-02, 3.818052635833305702e-02], 
-[6.734150657750828106e-01, 1.121715077759858903e-01, 3.883412117183511481e-02], 
-[6.734150657750828106e-01, 1.288763480443681220e-01, 3.963689109239521002e-02], 
-[6.734150657750828106e-01, 1.480689117455977755e-01, 4.062930529369063182e-02], 
-[6.734150657750828106e-01, 1.701196764046864207e-01, 4.186595000614350137e-02], 
-[6.734150657750828106e-01, 1.954542919161802172e-01, 4.342181007517320612e-02], 
-[6.734150657750828106e-01, 2.245617969409859638e-01, 4.540208915401111600e-02], 
-[6.734150657750828106e-01, 2.580040589080049296e-01, 4.795809201192528792e-02], 
-[6.734150657750828106e-01, 2.964266198426381838e-01, 5.131397328584008655e-02], 
-[6.734150657750828106e-01, 3.405711573811430193e-01, 5.581405468024253080e-02], 
-[6.734150657750828106e-01, 3.912898015080607528e-01, 6.201175760415036931e-02], 
-[6.734150657750828106e-01, 4.495615833752782953e-01, 7.085006064416192462e-02], 
-[6.734150657750828106e-01, 5.165113337172515529e-01, 8.406614119776417704e-02], 
-[6.734150657750828106e-01, 5.934313956619206021e-01, 1.052309844455691923e-01], 
-[6.734150657750828106e-01, 6.818065710636164178e-01, 1.430058507196662332e-01], 
-[6.734150657750828106e-01, 7.833427819015473803e-01, 2.252449564191462694e-01], 
-[6.734150657750828106e-01, 9.000000000000000222e-01, 5.207061197538116470e-01], 
-[6.734150657750828106e-01, 9.020408163265306589e-01, 5.319420903517061427e-01], 
-[6.734150657750828106e-01, 9.040816326530612956e-01, 5.436423495722788601e-01], 
-[6.734150657750828106e-01, 9.061224489795918213e-01, 5.558364925514975852e-01], 
-[6.734150657750828106e-01, 9.081632653061224580e-01, 5.685567004692531068e-01], 
-[6.734150657750828106e-01, 9.102040816326530948e-01, 5.818380304021865124e-01], 
-[6.734150657750828106e-01, 9.122448979591837315e-01, 5.957187451563779046e-01], 
-[6.734150657750828106e-01, 9.142857142857142572e-01, 6.102406896769421163e-01], 
-[6.734150657750828106e-01, 9.163265306122448939e-01, 6.254497219073735792e-01], 
-[6.734150657750828106e-01, 9.183673469387755306e-01, 6.413962075323323964e-01], 
-[6.734150657750828106e-01, 9.204081632653061673e-01, 6.581355899554048872e-01], 
-[6.734150657750828106e-01, 9.224489795918368040e-01, 6.757290492321019748e-01], 
-[6.734150657750828106e-01, 9.244897959183673297e-01, 6.942442666185661970e-01], 
-[6.734150657750828106e-01, 9.265306122448979664e-01, 7.137563150658400302e-01], 
-[6.734150657750828106e-01, 9.285714285714286031e-01, 7.343487005948492463e-01], 
-[6.734150657750828106e-01, 9.306122448979592399e-01, 7.561145853020863061e-01], 
-[6.734150657750828106e-01, 9.326530612244897656e-01, 7.791582301335073790e-01], 
-[6.734150657750828106e-01, 9.346938775510204023e-01, 8.035967050127378331e-01], 
-[6.734150657750828106e-01, 9.367346938775510390e-01, 8.295619260794795391e-01], 
-[6.734150657750828106e-01, 9.387755102040816757e-01, 8.572030955843488176e-01], 
-[6.734150657750828106e-01, 9.408163265306123124e-01, 8.866896406376939543e-01], 
-[6.734150657750828106e-01, 9.428571428571428381e-01, 9.182147742440894822e-01], 
-[6.734150657750828106e-01, 9.448979591836734748e-01, 9.519998382921235347e-01], 
-[6.734150657750828106e-01, 9.469387755102041115e-01, 9.882996368461389736e-01], 
-[6.734150657750828106e-01, 9.489795918367347483e-01, 1.027409034142021227e+00], 
-[6.734150657750828106e-01, 9.510204081632652739e-01, 1.069671182307183610e+00], 
-[6.734150657750828106e-01, 9.530612244897959107e-01, 1.115487869603609017e+00], 
-[6.734150657750828106e-01, 9.551020408163265474e-01, 1.165332656789563881e+00], 
-[6.734150657750828106e-01, 9.571428571428571841e-01, 1.219767721115104120e+00], 
-[6.734150657750828106e-01, 9.591836734693878208e-01, 1.279465691773403080e+00], 
-[6.734150657750828106e-01, 9.612244897959183465e-01, 1.345238296005522027e+00], 
-[6.734150657750828106e-01, 9.632653061224489832e-01, 1.418074435773928554e+00], 
-[6.734150657750828106e-01, 9.653061224489796199e-01, 1.499191535795697083e+00], 
-[6.734150657750828106e-01, 9.673469387755102566e-01, 1.590105905200395187e+00], 
-[6.734150657750828106e-01, 9.693877551020407823e-01, 1.692730887100374781e+00], 
-[6.734150657750828106e-01, 9.714285714285714191e-01, 1.809516533639691449e+00], 
-[6.734150657750828106e-01, 9.734693877551020558e-01, 1.943652911431316577e+00], 
-[6.734150657750828106e-01, 9.755102040816326925e-01, 2.099373725561339832e+00], 
-[6.734150657750828106e-01, 9.775510204081632182e-01, 2.282423349784522326e+00], 
-[6.734150657750828106e-01, 9.795918367346938549e-01, 2.500800273857948675e+00], 
-[6.734150657750828106e-01, 9.816326530612244916e-01, 2.765989316751817473e+00], 
-[6.734150657750828106e-01, 9.836734693877551283e-01, 3.095104870417268561e+00], 
-[6.734150657750828106e-01, 9.857142857142857650e-01, 3.514844289870392213e+00], 
-[6.734150657750828106e-01, 9.877551020408162907e-01, 4.069334443128182599e+00], 
-[6.734150657750828106e-01, 9.897959183673469274e-01, 4.837243244310048595e+00], 
-[6.734150657750828106e-01, 9.918367346938775642e-01, 5.974118100582981761e+00], 
-[6.734150657750828106e-01, 9.938775510204082009e-01, 7.837797737633147577e+00], 
-[6.734150657750828106e-01, 9.959183673469387266e-01, 1.148171595250803101e+01], 
-[6.734150657750828106e-01, 9.979591836734693633e-01, 2.201844058461148279e+01], 
-[6.734150657750828106e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[7.390722033525782830e-01, 1.000000000000000021e-03, 3.595186718517062036e-02], 
-[7.390722033525782830e-01, 1.148922311909569708e-03, 3.591733064757310356e-02], 
-[7.390722033525782830e-01, 1.320022478803632065e-03, 3.588353191948012028e-02], 
-[7.390722033525782830e-01, 1.516603278119670137e-03, 3.585058117674345263e-02], 
-[7.390722033525782830e-01, 1.742459344546885402e-03, 3.581860524810902974e-02], 
-[7.390722033525782830e-01, 2.001950418545241171e-03, 3.578775019579058525e-02], 
-[7.390722033525782830e-01, 2.300085503203331758e-03, 3.575818431599139813e-02], 
-[7.390722033525782830e-01, 2.642619553930058204e-03, 3.573010163377195181e-02], 
-[7.390722033525782830e-01, 3.036164567398761706e-03, 3.570372598181926344e-02], 
-[7.390722033525782830e-01, 3.488317214113704091e-03, 3.567931577121777331e-02], 
-[7.390722033525782830e-01, 4.007805478313466660e-03, 3.565716958557389737e-02], 
-[7.390722033525782830e-01, 4.604657135827751671e-03, 3.563763275853686074e-02], 
-[7.390722033525782830e-01, 5.290393322046124149e-03, 3.562110513142210944e-02], 
-[7.390722033525782830e-01, 6.078250926476181683e-03, 3.560805023351064358e-02], 
-[7.390722033525782830e-01, 6.983438106813499684e-03, 3.559900618633997371e-02], 
-[7.390722033525782830e-01, 8.023427854757562983e-03, 3.559459870845695095e-02], 
-[7.390722033525782830e-01, 9.218295280327699903e-03, 3.559555669399642325e-02], 
-[7.390722033525782830e-01, 1.059110512533918171e-02, 3.560273096431801343e-02], 
-[7.390722033525782830e-01, 1.216835698628199354e-02, 3.561711695600610489e-02], 
-[7.390722033525782830e-01, 1.398049684082008047e-02, 3.563988232470154116e-02], 
-[7.390722033525782830e-01, 1.606250475199945058e-02, 3.567240072994292549e-02], 
-[7.390722033525782830e-01, 1.845457009472566828e-02, 3.571629344734490036e-02], 
-[7.390722033525782830e-01, 2.120286733852943389e-02, 3.577348096627060159e-02], 
-[7.390722033525782830e-01, 2.436044736169515681e-02, 3.584624742403567238e-02], 
-[7.390722033525782830e-01, 2.798826150195019707e-02, 3.593732167352019224e-02], 
-[7.390722033525782830e-01, 3.215633811115024138e-02, 3.604998008386552794e-02], 
-[7.390722033525782830e-01, 3.694513432520856594e-02, 3.618817798590763524e-02], 
-[7.390722033525782830e-01, 4.244708914272822542e-02, 3.635671922084151436e-02], 
-[7.390722033525782830e-01, 4.876840779169493850e-02, 3.656147687182623174e-02], 
-[7.390722033525782830e-01, 5.603111182818285713e-02, 3.680968347229866822e-02], 
-[7.390722033525782830e-01, 6.437539454049952259e-02, 3.711031659747809908e-02], 
-[7.390722033525782830e-01, 7.396232712556144451e-02, 3.747461703185638038e-02], 
-[7.390722033525782830e-01, 8.497696787531199003e-02, 3.791679372489629302e-02], 
-[7.390722033525782830e-01, 9.763193439036874088e-02, 3.845499590071677770e-02], 
-[7.390722033525782830e-01, 1.121715077759858903e-01, 3.911267373181116086e-02], 
-[7.390722033525782830e-01, 1.288763480443681220e-01, 3.992051493423001696e-02], 
-[7.390722033525782830e-01, 1.480689117455977755e-01, 4.091925344299021661e-02], 
-[7.390722033525782830e-01, 1.701196764046864207e-01, 4.216383127757196425e-02], 
-[7.390722033525782830e-01, 1.954542919161802172e-01, 4.372971998130453786e-02], 
-[7.390722033525782830e-01, 2.245617969409859638e-01, 4.572280281880966579e-02], 
-[7.390722033525782830e-01, 2.580040589080049296e-01, 4.829535676135524036e-02], 
-[7.390722033525782830e-01, 2.964266198426381838e-01, 5.167296800231731269e-02], 
-[7.390722033525782830e-01, 3.405711573811430193e-01, 5.620214199339298305e-02], 
-[7.390722033525782830e-01, 3.912898015080607528e-01, 6.243978196323782259e-02], 
-[7.390722033525782830e-01, 4.495615833752782953e-01, 7.133474380001884885e-02], 
-[7.390722033525782830e-01, 5.165113337172515529e-01, 8.463491208236029184e-02], 
-[7.390722033525782830e-01, 5.934313956619206021e-01, 1.059329839194153300e-01], 
-[7.390722033525782830e-01, 6.818065710636164178e-01, 1.439419713306619997e-01], 
-[7.390722033525782830e-01, 7.833427819015473803e-01, 2.266785308672703558e-01], 
-[7.390722033525782830e-01, 9.000000000000000222e-01, 5.238436087064074487e-01], 
-[7.390722033525782830e-01, 9.020408163265306589e-01, 5.351425892545037533e-01], 
-[7.390722033525782830e-01, 9.040816326530612956e-01, 5.469083519633638479e-01], 
-[7.390722033525782830e-01, 9.061224489795918213e-01, 5.591706462572996195e-01], 
-[7.390722033525782830e-01, 9.081632653061224580e-01, 5.719618207829361145e-01], 
-[7.390722033525782830e-01, 9.102040816326530948e-01, 5.853171147118274575e-01], 
-[7.390722033525782830e-01, 9.122448979591837315e-01, 5.992749892197484218e-01], 
-[7.390722033525782830e-01, 9.142857142857142572e-01, 6.138775057717347217e-01], 
-[7.390722033525782830e-01, 9.163265306122448939e-01, 6.291707591238552277e-01], 
-[7.390722033525782830e-01, 9.183673469387755306e-01, 6.452053745210146740e-01], 
-[7.390722033525782830e-01, 9.204081632653061673e-01, 6.620370804970963086e-01], 
-[7.390722033525782830e-01, 9.224489795918368040e-01, 6.797273710637400379e-01], 
-[7.390722033525782830e-01, 9.244897959183673297e-01, 6.983442740282821415e-01], 
-[7.390722033525782830e-01, 9.265306122448979664e-01, 7.179632458681057816e-01], 
-[7.390722033525782830e-01, 9.285714285714286031e-01, 7.386682182157908727e-01], 
-[7.390722033525782830e-01, 9.306122448979592399e-01, 7.605528268517145474e-01], 
-[7.390722033525782830e-01, 9.326530612244897656e-01, 7.837218615230371332e-01], 
-[7.390722033525782830e-01, 9.346938775510204023e-01, 8.082929844010062759e-01], 
-[7.390722033525782830e-01, 9.367346938775510390e-01, 8.343987772152650084e-01], 
-[7.390722033525782830e-01, 9.387755102040816757e-01, 8.621891929679730282e-01], 
-[7.390722033525782830e-01, 9.408163265306123124e-01, 8.918345088780230689e-01], 
-[7.390722033525782830e-01, 9.428571428571428381e-01, 9.235289045662848917e-01], 
-[7.390722033525782830e-01, 9.448979591836734748e-01, 9.574948258984938843e-01], 
-[7.390722033525782830e-01, 9.469387755102041115e-01, 9.939883438041268171e-01], 
-[7.390722033525782830e-01, 9.489795918367347483e-01, 1.033305783748900364e+00], 
-[7.390722033525782830e-01, 9.510204081632652739e-01, 1.075791992572088018e+00], 
-[7.390722033525782830e-01, 9.530612244897959107e-01, 1.121850735753202155e+00], 
-[7.390722033525782830e-01, 9.551020408163265474e-01, 1.171957895774128566e+00], 
-[7.390722033525782830e-01, 9.571428571428571841e-01, 1.226678395304665159e+00], 
-[7.390722033525782830e-01, 9.591836734693878208e-01, 1.286688134891671886e+00], 
-[7.390722033525782830e-01, 9.612244897959183465e-01, 1.352802772615481874e+00], 
-[7.390722033525782830e-01, 9.632653061224489832e-01, 1.426015977480135977e+00], 
-[7.390722033525782830e-01, 9.653061224489796199e-01, 1.507551014620784890e+00], 
-[7.390722033525782830e-01, 9.673469387755102566e-01, 1.598931430318397462e+00], 
-[7.390722033525782830e-01, 9.693877551020407823e-01, 1.702079650210928552e+00], 
-[7.390722033525782830e-01, 9.714285714285714191e-01, 1.819457289144070344e+00], 
-[7.390722033525782830e-01, 9.734693877551020558e-01, 1.954269374940400539e+00], 
-[7.390722033525782830e-01, 9.755102040816326925e-01, 2.110769334833348942e+00], 
-[7.390722033525782830e-01, 9.775510204081632182e-01, 2.294728106380045318e+00], 
-[7.390722033525782830e-01, 9.795918367346938549e-01, 2.514180871261465278e+00], 
-[7.390722033525782830e-01, 9.816326530612244916e-01, 2.780664669095148867e+00], 
-[7.390722033525782830e-01, 9.836734693877551283e-01, 3.111370945838434210e+00], 
-[7.390722033525782830e-01, 9.857142857142857650e-01, 3.533115924901380378e+00], 
-[7.390722033525782830e-01, 9.877551020408162907e-01, 4.090220453149516544e+00], 
-[7.390722033525782830e-01, 9.897959183673469274e-01, 4.861693125644320546e+00], 
-[7.390722033525782830e-01, 9.918367346938775642e-01, 6.003742896590644307e+00], 
-[7.390722033525782830e-01, 9.938775510204082009e-01, 7.875695993797533490e+00], 
-[7.390722033525782830e-01, 9.959183673469387266e-01, 1.153523034589259844e+01], 
-[7.390722033525782830e-01, 9.979591836734693633e-01, 2.211448032966051613e+01], 
-[7.390722033525782830e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[8.111308307896872849e-01, 1.000000000000000021e-03, 3.621941216259143975e-02], 
-[8.111308307896872849e-01, 1.148922311909569708e-03, 3.618435275986679744e-02], 
-[8.111308307896872849e-01, 1.320022478803632065e-03, 3.615003620635962034e-02], 
-[8.111308307896872849e-01, 1.516603278119670137e-03, 3.611657342499369205e-02], 
-[8.111308307896872849e-01, 1.742459344546885402e-03, 3.608409210369979692e-02], 
-[8.111308307896872849e-01, 2.001950418545241171e-03, 3.605273929325188836e-02], 
-[8.111308307896872849e-01, 2.300085503203331758e-03, 3.602268442784069963e-02], 
-[8.111308307896872849e-01, 2.642619553930058204e-03, 3.599412284328068479e-02], 
-[8.111308307896872849e-01, 3.036164567398761706e-03, 3.596727988299809609e-02], 
-[8.111308307896872849e-01, 3.488317214113704091e-03, 3.594241570061757624e-02], 
-[8.111308307896872849e-01, 4.007805478313466660e-03, 3.591983089136277507e-02], 
-[8.111308307896872849e-01, 4.604657135827751671e-03, 3.589987311338155990e-02], 
-[8.111308307896872849e-01, 5.290393322046124149e-03, 3.588294489699430517e-02], 
-[8.111308307896872849e-01, 6.078250926476181683e-03, 3.586951288604495885e-02], 
-[8.111308307896872849e-01, 6.983438106813499684e-03, 3.586011881465934331e-02], 
-[8.111308307896872849e-01, 8.023427854757562983e-03, 3.585539259836366399e-02], 
-[8.111308307896872849e-01, 9.218295280327699903e-03, 3.585606801604859784e-02], 
-[8.111308307896872849e-01, 1.059110512533918171e-02, 3.586300158595079335e-02], 
-[8.111308307896872849e-01, 1.216835698628199354e-02, 3.587719540398345841e-02], 
-[8.111308307896872849e-01, 1.398049684082008047e-02, 3.589982493030857702e-02], 
-[8.111308307896872849e-01, 1.606250475199945058e-02, 3.593227299762676713e-02], 
-[8.111308307896872849e-01, 1.845457009472566828e-02, 3.597617169828690870e-02], 
-[8.111308307896872849e-01, 2.120286733852943389e-02, 3.603345432247181263e-02], 
-[8.111308307896872849e-01, 2.436044736169515681e-02, 3.610642021708690419e-02], 
-[8.111308307896872849e-01, 2.798826150195019707e-02, 3.619781638693080755e-02], 
-[8.111308307896872849e-01, 3.215633811115024138e-02, 3.631094097092640860e-02], 
-[8.111308307896872849e-01, 3.694513432520856594e-02, 3.644977554981480850e-02], 
-[8.111308307896872849e-01, 4.244708914272822542e-02, 3.661915580488493693e-02], 
-[8.111308307896872849e-01, 4.876840779169493850e-02, 3.682499369166762626e-02], 
-[8.111308307896872849e-01, 5.603111182818285713e-02, 3.707456953980178133e-02], 
-[8.111308307896872849e-01, 6.437539454049952259e-02, 3.737692015132605683e-02], 
-[8.111308307896872849e-01, 7.396232712556144451e-02, 3.774336032737377056e-02], 
-[8.111308307896872849e-01, 8.497696787531199003e-02, 3.818819237996169680e-02], 
-[8.111308307896872849e-01, 9.763193439036874088e-02, 3.872968450335155521e-02], 
-[8.111308307896872849e-01, 1.121715077759858903e-01, 3.939144018042406437e-02], 
-[8.111308307896872849e-01, 1.288763480443681220e-01, 4.020434715757674471e-02], 
-[8.111308307896872849e-01, 1.480689117455977755e-01, 4.120940399750783883e-02], 
-[8.111308307896872849e-01, 1.701196764046864207e-01, 4.246190831153064810e-02], 
-[8.111308307896872849e-01, 1.954542919161802172e-01, 4.403781804390734245e-02], 
-[8.111308307896872849e-01, 2.245617969409859638e-01, 4.604369561303238434e-02], 
-[8.111308307896872849e-01, 2.580040589080049296e-01, 4.863278946787158441e-02], 
-[8.111308307896872849e-01, 2.964266198426381838e-01, 5.203211617481143247e-02], 
-[8.111308307896872849e-01, 3.405711573811430193e-01, 5.659036292294602338e-02], 
-[8.111308307896872849e-01, 3.912898015080607528e-01, 6.286791117872150836e-02], 
-[8.111308307896872849e-01, 4.495615833752782953e-01, 7.181948733962037479e-02], 
-[8.111308307896872849e-01, 5.165113337172515529e-01, 8.520366917075239410e-02], 
-[8.111308307896872849e-01, 5.934313956619206021e-01, 1.066348333061539477e-01], 
-[8.111308307896872849e-01, 6.818065710636164178e-01, 1.448776539260445140e-01], 
-[8.111308307896872849e-01, 7.833427819015473803e-01, 2.281108928639618005e-01], 
-[8.111308307896872849e-01, 9.000000000000000222e-01, 5.269761298713664388e-01], 
-[8.111308307896872849e-01, 9.020408163265306589e-01, 5.383379572555879733e-01], 
-[8.111308307896872849e-01, 9.040816326530612956e-01, 5.501690523720929038e-01], 
-[8.111308307896872849e-01, 9.061224489795918213e-01, 5.624993183760493842e-01], 
-[8.111308307896872849e-01, 9.081632653061224580e-01, 5.753612707714754748e-01], 
-[8.111308307896872849e-01, 9.102040816326530948e-01, 5.887903301575574400e-01], 
-[8.111308307896872849e-01, 9.122448979591837315e-01, 6.028251553475864055e-01], 
-[8.111308307896872849e-01, 9.142857142857142572e-01, 6.175080235214647217e-01], 
-[8.111308307896872849e-01, 9.163265306122448939e-01, 6.328852653607301981e-01], 
-[8.111308307896872849e-01, 9.183673469387755306e-01, 6.490077646907934650e-01], 
-[8.111308307896872849e-01, 9.204081632653061673e-01, 6.659315340912062009e-01], 
-[8.111308307896872849e-01, 9.224489795918368040e-01, 6.837183803259937465e-01], 
-[8.111308307896872849e-01, 9.244897959183673297e-01, 7.024366764142172537e-01], 
-[8.111308307896872849e-01, 9.265306122448979664e-01, 7.221622608649830299e-01], 
-[8.111308307896872849e-01, 9.285714285714286031e-01, 7.429794892499212988e-01], 
-[8.111308307896872849e-01, 9.306122448979592399e-01, 7.649824691557267631e-01], 
-[8.111308307896872849e-01, 9.326530612244897656e-01, 7.882765170162655544e-01], 
-[8.111308307896872849e-01, 9.346938775510204023e-01, 8.129798848608532635e-01], 
-[8.111308307896872849e-01, 9.367346938775510390e-01, 8.392258172988102949e-01], 
-[8.111308307896872849e-01, 9.387755102040816757e-01, 8.671650149978569200e-01], 
-[8.111308307896872849e-01, 9.408163265306123124e-01, 8.969686017571010250e-01], 
-[8.111308307896872849e-01, 9.428571428571428381e-01, 9.288317197618094490e-01], 
-[8.111308307896872849e-01, 9.448979591836734748e-01, 9.629779141797335518e-01], 
-[8.111308307896872849e-01, 9.469387755102041115e-01, 9.996645173839452392e-01], 
-[8.111308307896872849e-01, 9.489795918367347483e-01, 1.039189309748697276e+00], 
-[8.111308307896872849e-01, 9.510204081632652739e-01, 1.081898825411574894e+00], 
-[8.111308307896872849e-01, 9.530612244897959107e-01, 1.128198798320051210e+00], 
-[8.111308307896872849e-01, 9.551020408163265474e-01, 1.178567422282435162e+00], 
-[8.111308307896872849e-01, 9.571428571428571841e-01, 1.233572352940987660e+00], 
-[8.111308307896872849e-01, 9.591836734693878208e-01, 1.293892747173299274e+00], 
-[8.111308307896872849e-01, 9.612244897959183465e-01, 1.360348175605456511e+00], 
-[8.111308307896872849e-01, 9.632653061224489832e-01, 1.433937051787987471e+00], 
-[8.111308307896872849e-01, 9.653061224489796199e-01, 1.515888453311528661e+00], 
-[8.111308307896872849e-01, 9.673469387755102566e-01, 1.607733128428659120e+00], 
-[8.111308307896872849e-01, 9.693877551020407823e-01, 1.711402540443344611e+00], 
-[8.111308307896872849e-01, 9.714285714285714191e-01, 1.829369808825962229e+00], 
-[8.111308307896872849e-01, 9.734693877551020558e-01, 1.964854846114524323e+00], 
-[8.111308307896872849e-01, 9.755102040816326925e-01, 2.122130698932097381e+00], 
-[8.111308307896872849e-01, 9.775510204081632182e-01, 2.306994727415440316e+00], 
-[8.111308307896872849e-01, 9.795918367346938549e-01, 2.527518605832309362e+00], 
-[8.111308307896872849e-01, 9.816326530612244916e-01, 2.795291304023488799e+00], 
-[8.111308307896872849e-01, 9.836734693877551283e-01, 3.127580882323366396e+00], 
-[8.111308307896872849e-01, 9.857142857142857650e-01, 3.551321734941583763e+00], 
-[8.111308307896872849e-01, 9.877551020408162907e-01, 4.111027512729186206e+00], 
-[8.111308307896872849e-01, 9.897959183673469274e-01, 4.886045352811807518e+00], 
-[8.111308307896872849e-01, 9.918367346938775642e-01, 6.033241424823067689e+00], 
-[8.111308307896872849e-01, 9.938775510204082009e-01, 7.913419207852474102e+00], 
-[8.111308307896872849e-01, 9.959183673469387266e-01, 1.158846949470334664e+01], 
-[8.111308307896872849e-01, 9.979591836734693633e-01, 2.220993347562179210e+01], 
-[8.111308307896872849e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[8.902150854450392448e-01, 1.000000000000000021e-03, 3.648731827200430572e-02], 
-[8.902150854450392448e-01, 1.148922311909569708e-03, 3.645173177947338972e-02], 
-[8.902150854450392448e-01, 1.320022478803632065e-03, 3.641689317658808323e-02], 
-[8.902150854450392448e-01, 1.516603278119670137e-03, 3.638291413338042707e-02], 
-[8.902150854450392448e-01, 1.742459344546885402e-03, 3.634992319699738295e-02], 
-[8.902150854450392448e-01, 2.001950418545241171e-03, 3.631806840679745879e-02], 
-[8.902150854450392448e-01, 2.300085503203331758e-03, 3.628752033497330276e-02], 
-[8.902150854450392448e-01, 2.642619553930058204e-03, 3.625847562809458857e-02], 
-[8.902150854450392448e-01, 3.036164567398761706e-03, 3.623116114031044860e-02], 
-[8.902150854450392448e-01, 3.488317214113704091e-03, 3.620583876774649545e-02], 
-[8.902150854450392448e-01, 4.007805478313466660e-03, 3.618281111717502191e-02], 
-[8.902150854450392448e-01, 4.604657135827751671e-03, 3.616242817113658053e-02], 
-[8.902150854450392448e-01, 5.290393322046124149e-03, 3.614509514880289570e-02], 
-[8.902150854450392448e-01, 6.078250926476181683e-03, 3.613128180836770037e-02], 
-[8.902150854450392448e-01, 6.983438106813499684e-03, 3.612153349625684545e-02], 
-[8.902150854450392448e-01, 8.023427854757562983e-03, 3.611648432459362013e-02], 
-[8.902150854450392448e-01, 9.218295280327699903e-03, 3.611687295652458302e-02], 
-[8.902150854450392448e-01, 1.059110512533918171e-02, 3.612356160651610665e-02], 
-[8.902150854450392448e-01, 1.216835698628199354e-02, 3.613755902897798633e-02], 
-[8.902150854450392448e-01, 1.398049684082008047e-02, 3.616004848752871204e-02], 
-[8.902150854450392448e-01, 1.606250475199945058e-02, 3.619242198667302346e-02], 
-[8.902150854450392448e-01, 1.845457009472566828e-02, 3.623632243376392892e-02], 
-[8.902150854450392448e-01, 2.120286733852943389e-02, 3.629369591759933067e-02], 
-[8.902150854450392448e-01, 2.436044736169515681e-02, 3.636685699186062437e-02], 
-[8.902150854450392448e-01, 2.798826150195019707e-02, 3.645857080966258268e-02], 
-[8.902150854450392448e-01, 3.215633811115024138e-02, 3.657215727507804465e-02], 
-[8.902150854450392448e-01, 3.694513432520856594e-02, 3.671162421276570609e-02], 
-[8.902150854450392448e-01, 4.244708914272822542e-02, 3.688183913631612465e-02], 
-[8.902150854450392448e-01, 4.876840779169493850e-02, 3.708875286341170585e-02], 
-[8.902150854450392448e-01, 5.603111182818285713e-02, 3.733969350636962004e-02], 
-[8.902150854450392448e-01, 6.437539454049952259e-02, 3.764375707597525378e-02], 
-[8.902150854450392448e-01, 7.396232712556144451e-02, 3.801233236558787532e-02], 
-[8.902150854450392448e-01, 8.497696787531199003e-02, 3.845981501640198530e-02], 
-[8.902150854450392448e-01, 9.763193439036874088e-02, 3.900459214660858404e-02], 
-[8.902150854450392448e-01, 1.121715077759858903e-01, 3.967042048459571563e-02], 
-[8.902150854450392448e-01, 1.288763480443681220e-01, 4.048838771464398356e-02], 
-[8.902150854450392448e-01, 1.480689117455977755e-01, 4.149975689317988992e-02], 
-[8.902150854450392448e-01, 1.701196764046864207e-01, 4.276018102574659363e-02], 
-[8.902150854450392448e-01, 1.954542919161802172e-01, 4.434610416007297995e-02], 
-[8.902150854450392448e-01, 2.245617969409859638e-01, 4.636476741007161673e-02], 
-[8.902150854450392448e-01, 2.580040589080049296e-01, 4.897038997727055226e-02], 
-[8.902150854450392448e-01, 2.964266198426381838e-01, 5.239141761653432622e-02], 
-[8.902150854450392448e-01, 3.405711573811430193e-01, 5.697871724313019470e-02], 
-[8.902150854450392448e-01, 3.912898015080607528e-01, 6.329614497770164050e-02], 
-[8.902150854450392448e-01, 4.495615833752782953e-01, 7.230429093293126719e-02], 
-[8.902150854450392448e-01, 5.165113337172515529e-01, 8.577241206497782100e-02], 
-[8.902150854450392448e-01, 5.934313956619206021e-01, 1.073365321347977130e-01], 
-[8.902150854450392448e-01, 6.818065710636164178e-01, 1.458128979958068228e-01], 
-[8.902150854450392448e-01, 7.833427819015473803e-01, 2.295420421489898222e-01], 
-[8.902150854450392448e-01, 9.000000000000000222e-01, 5.301036866954262905e-01], 
-[8.902150854450392448e-01, 9.020408163265306589e-01, 5.415281980128565653e-01], 
-[8.902150854450392448e-01, 9.040816326530612956e-01, 5.534244546809878873e-01], 
-[8.902150854450392448e-01, 9.061224489795918213e-01, 5.658225130294505245e-01], 
-[8.902150854450392448e-01, 9.081632653061224580e-01, 5.787550548115227844e-01], 
-[8.902150854450392448e-01, 9.102040816326530948e-01, 5.922576813880768842e-01], 
-[8.902150854450392448e-01, 9.122448979591837315e-01, 6.063692484792184700e-01], 
-[8.902150854450392448e-01, 9.142857142857142572e-01, 6.211322481763018599e-01], 
-[8.902150854450392448e-01, 9.163265306122448939e-01, 6.365932462010526205e-01], 
-[8.902150854450392448e-01, 9.183673469387755306e-01, 6.528033839816833606e-01], 
-[8.902150854450392448e-01, 9.204081632653061673e-01, 6.698189570610610932e-01], 
-[8.902150854450392448e-01, 9.224489795918368040e-01, 6.877020837543961207e-01], 
-[8.902150854450392448e-01, 9.244897959183673297e-01, 7.065214809558719722e-01], 
-[8.902150854450392448e-01, 9.265306122448979664e-01, 7.263533677149296430e-01], 
-[8.902150854450392448e-01, 9.285714285714286031e-01, 7.472825218732830344e-01], 
-[8.902150854450392448e-01, 9.306122448979592399e-01, 7.694035209505455386e-01], 
-[8.902150854450392448e-01, 9.326530612244897656e-01, 7.928222059574787650e-01], 
-[8.902150854450392448e-01, 9.346938775510204023e-01, 8.176574163973031606e-01], 
-[8.902150854450392448e-01, 9.367346938775510390e-01, 8.440430570549173339e-01], 
-[8.902150854450392448e-01, 9.387755102040816757e-01, 8.721305731847265319e-01], 
-[8.902150854450392448e-01, 9.408163265306123124e-01, 9.020919316459490300e-01], 
-[8.902150854450392448e-01, 9.428571428571428381e-01, 9.341232331458988458e-01], 
-[8.902150854450392448e-01, 9.448979591836734748e-01, 9.684491174903522293e-01], 
-[8.902150854450392448e-01, 9.469387755102041115e-01, 1.005328173087523647e+00], 
-[8.902150854450392448e-01, 9.489795918367347483e-01, 1.045059628914359884e+00], 
-[8.902150854450392448e-01, 9.510204081632652739e-01, 1.087991699011553681e+00], 
-[8.902150854450392448e-01, 9.530612244897959107e-01, 1.134532077066911615e+00], 
-[8.902150854450392448e-01, 9.551020408163265474e-01, 1.185161257844390859e+00], 
-[8.902150854450392448e-01, 9.571428571428571841e-01, 1.240449617543514016e+00], 
-[8.902150854450392448e-01, 9.591836734693878208e-01, 1.301079554388899773e+00], 
-[8.902150854450392448e-01, 9.612244897959183465e-01, 1.367874533307391172e+00], 
-[8.902150854450392448e-01, 9.632653061224489832e-01, 1.441837689961484648e+00], 
-[8.902150854450392448e-01, 9.653061224489796199e-01, 1.524203886511192874e+00], 
-[8.902150854450392448e-01, 9.673469387755102566e-01, 1.616511038098732422e+00], 
-[8.902150854450392448e-01, 9.693877551020407823e-01, 1.720699600961329345e+00], 
-[8.902150854450392448e-01, 9.714285714285714191e-01, 1.839254141284263122e+00], 
-[8.902150854450392448e-01, 9.734693877551020558e-01, 1.975409380051127428e+00], 
-[8.902150854450392448e-01, 9.755102040816326925e-01, 2.133457880824202846e+00], 
-[8.902150854450392448e-01, 9.775510204081632182e-01, 2.319223285528270395e+00], 
-[8.902150854450392448e-01, 9.795918367346938549e-01, 2.540813562302812301e+00], 
-[8.902150854450392448e-01, 9.816326530612244916e-01, 2.809869321715624757e+00], 
-[8.902150854450392448e-01, 9.836734693877551283e-01, 3.143734800289559317e+00], 
-[8.902150854450392448e-01, 9.857142857142857650e-01, 3.569461867789242238e+00], 
-[8.902150854450392448e-01, 9.877551020408162907e-01, 4.131755808267678631e+00], 
-[8.902150854450392448e-01, 9.897959183673469274e-01, 4.910300169720914099e+00], 
-[8.902150854450392448e-01, 9.918367346938775642e-01, 6.062614021784591856e+00], 
-[8.902150854450392448e-01, 9.938775510204082009e-01, 7.950967884107500439e+00], 
-[8.902150854450392448e-01, 9.959183673469387266e-01, 1.164143427610314063e+01], 
-[8.902150854450392448e-01, 9.979591836734693633e-01, 2.230480220154093729e+01], 
-[8.902150854450392448e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[9.770099572992256842e-01, 1.000000000000000021e-03, 3.675558576056042748e-02], 
-[9.770099572992256842e-01, 1.148922311909569708e-03, 3.671946794656456847e-02], 
-[9.770099572992256842e-01, 1.320022478803632065e-03, 3.668410306334921045e-02], 
-[9.770099572992256842e-01, 1.516603278119670137e-03, 3.664960352808949162e-02], 
-[9.770099572992256842e-01, 1.742459344546885402e-03, 3.661609874717864505e-02], 
-[9.770099572992256842e-01, 2.001950418545241171e-03, 3.658373774858246497e-02], 
-[9.770099572992256842e-01, 2.300085503203331758e-03, 3.655269224250814325e-02], 
-[9.770099572992256842e-01, 2.642619553930058204e-03, 3.652316018627968508e-02], 
-[9.770099572992256842e-01, 3.036164567398761706e-03, 3.649536994475039570e-02], 
-[9.770099572992256842e-01, 3.488317214113704091e-03, 3.646958515650489119e-02], 
-[9.770099572992256842e-01, 4.007805478313466660e-03, 3.644611043979242154e-02], 
-[9.770099572992256842e-01, 4.604657135827751671e-03, 3.642529810143647212e-02], 
-[9.770099572992256842e-01, 5.290393322046124149e-03, 3.640755604930260431e-02], 
-[9.770099572992256842e-01, 6.078250926476181683e-03, 3.639335715571620500e-02], 
-[9.770099572992256842e-01, 6.983438106813499684e-03, 3.638325037910940946e-02], 
-[9.770099572992256842e-01, 8.023427854757562983e-03, 3.637787402781399171e-02], 
-[9.770099572992256842e-01, 9.218295280327699903e-03, 3.637797164872494382e-02], 
-[9.770099572992256842e-01, 1.059110512533918171e-02, 3.638441115188253971e-02], 
-[9.770099572992256842e-01, 1.216835698628199354e-02, 3.639820794935105797e-02], 
-[9.770099572992256842e-01, 1.398049684082008047e-02, 3.642055310712932759e-02], 
-[9.770099572992256842e-01, 1.606250475199945058e-02, 3.645284780015461967e-02], 
-[9.770099572992256842e-01, 1.845457009472566828e-02, 3.649674574903827295e-02], 
-[9.770099572992256842e-01, 2.120286733852943389e-02, 3.655420583897023290e-02], 
-[9.770099572992256842e-01, 2.436044736169515681e-02, 3.662755782757207840e-02], 
-[9.770099572992256842e-01, 2.798826150195019707e-02, 3.671958501264657032e-02], 
-[9.770099572992256842e-01, 3.215633811115024138e-02, 3.683362905875420257e-02], 
-[9.770099572992256842e-01, 3.694513432520856594e-02, 3.697372402844712608e-02], 
-[9.770099572992256842e-01, 4.244708914272822542e-02, 3.714476925978141275e-02], 
-[9.770099572992256842e-01, 4.876840779169493850e-02, 3.735275442231809906e-02], 
-[9.770099572992256842e-01, 5.603111182818285713e-02, 3.760505539746487880e-02], 
-[9.770099572992256842e-01, 6.437539454049952259e-02, 3.791082738660323664e-02], 
-[9.770099572992256842e-01, 7.396232712556144451e-02, 3.828153315080748409e-02], 
-[9.770099572992256842e-01, 8.497696787531199003e-02, 3.873166162695575176e-02], 
-[9.770099572992256842e-01, 9.763193439036874088e-02, 3.927971881080827288e-02], 
-[9.770099572992256842e-01, 1.121715077759858903e-01, 3.994961461119694163e-02], 
-[9.770099572992256842e-01, 1.288763480443681220e-01, 4.077263655759009314e-02], 
-[9.770099572992256842e-01, 1.480689117455977755e-01, 4.179031206589488290e-02], 
-[9.770099572992256842e-01, 1.701196764046864207e-01, 4.305864933790337634e-02], 
-[9.770099572992256842e-01, 1.954542919161802172e-01, 4.465457822685665185e-02], 
-[9.770099572992256842e-01, 2.245617969409859638e-01, 4.668601808329498476e-02], 
-[9.770099572992256842e-01, 2.580040589080049296e-01, 4.930815813534090292e-02], 
-[9.770099572992256842e-01, 2.964266198426381838e-01, 5.275087214071780273e-02], 
-[9.770099572992256842e-01, 3.405711573811430193e-01, 5.736720472823125805e-02], 
-[9.770099572992256842e-01, 3.912898015080607528e-01, 6.372448308739470102e-02], 
-[9.770099572992256842e-01, 4.495615833752782953e-01, 7.278915425012473517e-02], 
-[9.770099572992256842e-01, 5.165113337172515529e-01, 8.634114036743172071e-02], 
-[9.770099572992256842e-01, 5.934313956619206021e-01, 1.080380799349718590e-01], 
-[9.770099572992256842e-01, 6.818065710636164178e-01, 1.467477030310203601e-01], 
-[9.770099572992256842e-01, 7.833427819015473803e-01, 2.309719784641133256e-01], 
-[9.770099572992256842e-01, 9.000000000000000222e-01, 5.332262826278096890e-01], 
-[9.770099572992256842e-01, 9.020408163265306589e-01, 5.447133151866095924e-01], 
-[9.770099572992256842e-01, 9.040816326530612956e-01, 5.566745627748783676e-01], 
-[9.770099572992256842e-01, 9.061224489795918213e-01, 5.691402343414080356e-01], 
-[9.770099572992256842e-01, 9.081632653061224580e-01, 5.821431772818090877e-01], 
-[9.770099572992256842e-01, 9.102040816326530948e-01, 5.957191730540262187e-01], 
-[9.770099572992256842e-01, 9.122448979591837315e-01, 6.099072735557551361e-01], 
-[9.770099572992256842e-01, 9.142857142857142572e-01, 6.247501849880245928e-01], 
-[9.770099572992256842e-01, 9.163265306122448939e-01, 6.402947072292892727e-01], 
-[9.770099572992256842e-01, 9.183673469387755306e-01, 6.565922383348885560e-01], 
-[9.770099572992256842e-01, 9.204081632653061673e-01, 6.736993557309236547e-01], 
-[9.770099572992256842e-01, 9.224489795918368040e-01, 6.916784880851354345e-01], 
-[9.770099572992256842e-01, 9.244897959183673297e-01, 7.105986948330863529e-01], 
-[9.770099572992256842e-01, 9.265306122448979664e-01, 7.305365740763858362e-01], 
-[9.770099572992256842e-01, 9.285714285714286031e-01, 7.515773242615255700e-01], 
-[9.770099572992256842e-01, 9.306122448979592399e-01, 7.738159909717274854e-01], 
-[9.770099572992256842e-01, 9.326530612244897656e-01, 7.973589376895857672e-01], 
-[9.770099572992256842e-01, 9.346938775510204023e-01, 8.223255890134220092e-01], 
-[9.770099572992256842e-01, 9.367346938775510390e-01, 8.488505072057797030e-01], 
-[9.770099572992256842e-01, 9.387755102040816757e-01, 8.770858790359715718e-01], 
-[9.770099572992256842e-01, 9.408163265306123124e-01, 9.072045109114162953e-01], 
-[9.770099572992256842e-01, 9.428571428571428381e-01, 9.394034580286608760e-01], 
-[9.770099572992256842e-01, 9.448979591836734748e-01, 9.739084501786483550e-01], 
-[9.770099572992256842e-01, 9.469387755102041115e-01, 1.010979326409350731e+00], 
-[9.770099572992256842e-01, 9.489795918367347483e-01, 1.050916758009977858e+00], 
-[9.770099572992256842e-01, 9.510204081632652739e-01, 1.094070631547448880e+00], 
-[9.770099572992256842e-01, 9.530612244897959107e-01, 1.140850591744177134e+00], 
-[9.770099572992256842e-01, 9.551020408163265474e-01, 1.191739423975369139e+00], 
-[9.770099572992256842e-01, 9.571428571428571841e-01, 1.247310212614616276e+00], 
-[9.770099572992256842e-01, 9.591836734693878208e-01, 1.308248582289059936e+00], 
-[9.770099572992256842e-01, 9.612244897959183465e-01, 1.375381874029721896e+00], 
-[9.770099572992256842e-01, 9.632653061224489832e-01, 1.449717923237002326e+00], 
-[9.770099572992256842e-01, 9.653061224489796199e-01, 1.532497348830508921e+00], 
-[9.770099572992256842e-01, 9.673469387755102566e-01, 1.625265197857731492e+00], 
-[9.770099572992256842e-01, 9.693877551020407823e-01, 1.729970874882996723e+00], 
-[9.770099572992256842e-01, 9.714285714285714191e-01, 1.849110335063520960e+00], 
-[9.770099572992256842e-01, 9.734693877551020558e-01, 1.985933031782451508e+00], 
-[9.770099572992256842e-01, 9.755102040816326925e-01, 2.144750943397456755e+00], 
-[9.770099572992256842e-01, 9.775510204081632182e-01, 2.331413853259875602e+00], 
-[9.770099572992256842e-01, 9.795918367346938549e-01, 2.554065825286455649e+00], 
-[9.770099572992256842e-01, 9.816326530612244916e-01, 2.824398822201394488e+00], 
-[9.770099572992256842e-01, 9.836734693877551283e-01, 3.159832819964390360e+00], 
-[9.770099572992256842e-01, 9.857142857142857650e-01, 3.587536470994144189e+00], 
-[9.770099572992256842e-01, 9.877551020408162907e-01, 4.152405525830653588e+00], 
-[9.770099572992256842e-01, 9.897959183673469274e-01, 4.934457819809363599e+00], 
-[9.770099572992256842e-01, 9.918367346938775642e-01, 6.091861023276329057e+00], 
-[9.770099572992256842e-01, 9.938775510204082009e-01, 7.988342525716284115e+00], 
-[9.770099572992256842e-01, 9.959183673469387266e-01, 1.169412556500008193e+01], 
-[9.770099572992256842e-01, 9.979591836734693633e-01, 2.239908867984608776e+01], 
-[9.770099572992256842e-01, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.072267222010324206e+00, 1.000000000000000021e-03, 3.702421487548161055e-02], 
-[1.072267222010324206e+00, 1.148922311909569708e-03, 3.698756150137849641e-02], 
-[1.072267222010324206e+00, 1.320022478803632065e-03, 3.695166609988897316e-02], 
-[1.072267222010324206e+00, 1.516603278119670137e-03, 3.691664183536499250e-02], 
-[1.072267222010324206e+00, 1.742459344546885402e-03, 3.688261897347466789e-02], 
-[1.072267222010324206e+00, 2.001950418545241171e-03, 3.684974753081216720e-02], 
-[1.072267222010324206e+00, 2.300085503203331758e-03, 3.681820035561012699e-02], 
-[1.072267222010324206e+00, 2.642619553930058204e-03, 3.678817671594392102e-02], 
-[1.072267222010324206e+00, 3.036164567398761706e-03, 3.675990648734987071e-02], 
-[1.072267222010324206e+00, 3.488317214113704091e-03, 3.673365505082689525e-02], 
-[1.072267222010324206e+00, 4.007805478313466660e-03, 3.670972903602635201e-02], 
-[1.072267222010324206e+00, 4.604657135827751671e-03, 3.668848307394142333e-02], 
-[1.072267222010324206e+00, 5.290393322046124149e-03, 3.667032776096962321e-02], 
-[1.072267222010324206e+00, 6.078250926476181683e-03, 3.665573908334523318e-02], 
-[1.072267222010324206e+00, 6.983438106813499684e-03, 3.664526961120735671e-02], 
-[1.072267222010324206e+00, 8.023427854757562983e-03, 3.663956184870120758e-02], 
-[1.072267222010324206e+00, 9.218295280327699903e-03, 3.663936422595549802e-02], 
-[1.072267222010324206e+00, 1.059110512533918171e-02, 3.664555034791996957e-02], 
-[1.072267222010324206e+00, 1.216835698628199354e-02, 3.665914228346135728e-02], 
-[1.072267222010324206e+00, 1.398049684082008047e-02, 3.668133889987100493e-02], 
-[1.072267222010324206e+00, 1.606250475199945058e-02, 3.671355054113377425e-02], 
-[1.072267222010324206e+00, 1.845457009472566828e-02, 3.675744173935767412e-02], 
-[1.072267222010324206e+00, 2.120286733852943389e-02, 3.681498417388310435e-02], 
-[1.072267222010324206e+00, 2.436044736169515681e-02, 3.688852280341425871e-02], 
-[1.072267222010324206e+00, 2.798826150195019707e-02, 3.698085906678776069e-02], 
-[1.072267222010324206e+00, 3.215633811115024138e-02, 3.709535638435894345e-02], 
-[1.072267222010324206e+00, 3.694513432520856594e-02, 3.723607505051268474e-02], 
-[1.072267222010324206e+00, 4.244708914272822542e-02, 3.740794621989060320e-02], 
-[1.072267222010324206e+00, 4.876840779169493850e-02, 3.761699840360663294e-02], 
-[1.072267222010324206e+00, 5.603111182818285713e-02, 3.787065523850742521e-02], 
-[1.072267222010324206e+00, 6.437539454049952259e-02, 3.817813109834208157e-02], 
-[1.072267222010324206e+00, 7.396232712556144451e-02, 3.855096268729366754e-02], 
-[1.072267222010324206e+00, 8.497696787531199003e-02, 3.900373220431203186e-02], 
-[1.072267222010324206e+00, 9.763193439036874088e-02, 3.955506447622032101e-02], 
-[1.072267222010324206e+00, 1.121715077759858903e-01, 4.022902252704754766e-02], 
-[1.072267222010324206e+00, 1.288763480443681220e-01, 4.105709363852324406e-02], 
-[1.072267222010324206e+00, 1.480689117455977755e-01, 4.208106945149352185e-02], 
-[1.072267222010324206e+00, 1.701196764046864207e-01, 4.335731316564123139e-02], 
-[1.072267222010324206e+00, 1.954542919161802172e-01, 4.496324014127760921e-02], 
-[1.072267222010324206e+00, 2.245617969409859638e-01, 4.700744750604550493e-02], 
-[1.072267222010324206e+00, 2.580040589080049296e-01, 4.964609378786410954e-02], 
-[1.072267222010324206e+00, 2.964266198426381838e-01, 5.311047956060747921e-02], 
-[1.072267222010324206e+00, 3.405711573811430193e-01, 5.775582515259223421e-02], 
-[1.072267222010324206e+00, 3.912898015080607528e-01, 6.415292523513366207e-02], 
-[1.072267222010324206e+00, 4.495615833752782953e-01, 7.327407696158272365e-02], 
-[1.072267222010324206e+00, 5.165113337172515529e-01, 8.690985368086723284e-02], 
-[1.072267222010324206e+00, 5.934313956619206021e-01, 1.087394762369139067e-01], 
-[1.072267222010324206e+00, 6.818065710636164178e-01, 1.476820685238337816e-01], 
-[1.072267222010324206e+00, 7.833427819015473803e-01, 2.324007015530787923e-01], 
-[1.072267222010324206e+00, 9.000000000000000222e-01, 5.363439211202143397e-01], 
-[1.072267222010324206e+00, 9.020408163265306589e-01, 5.478933124395392040e-01], 
-[1.072267222010324206e+00, 9.040816326530612956e-01, 5.599193805408906321e-01], 
-[1.072267222010324206e+00, 9.061224489795918213e-01, 5.724524864380144962e-01], 
-[1.072267222010324206e+00, 9.081632653061224580e-01, 5.855256425631309991e-01], 
-[1.072267222010324206e+00, 9.102040816326530948e-01, 5.991748098079748841e-01], 
-[1.072267222010324206e+00, 9.122448979591837315e-01, 6.134392355200795066e-01], 
-[1.072267222010324206e+00, 9.142857142857142572e-01, 6.283618392100072114e-01], 
-[1.072267222010324206e+00, 9.163265306122448939e-01, 6.439896540313030382e-01], 
-[1.072267222010324206e+00, 9.183673469387755306e-01, 6.603743336927870855e-01], 
-[1.072267222010324206e+00, 9.204081632653061673e-01, 6.775727364259809260e-01], 
-[1.072267222010324206e+00, 9.224489795918368040e-01, 6.956476000550414485e-01], 
-[1.072267222010324206e+00, 9.244897959183673297e-01, 7.146683252260235264e-01], 
-[1.072267222010324206e+00, 9.265306122448979664e-01, 7.347118876077538552e-01], 
-[1.072267222010324206e+00, 9.285714285714286031e-01, 7.558639045898416509e-01], 
-[1.072267222010324206e+00, 9.306122448979592399e-01, 7.782198879539412584e-01], 
-[1.072267222010324206e+00, 9.326530612244897656e-01, 8.018867215540990134e-01], 
-[1.072267222010324206e+00, 9.346938775510204023e-01, 8.269844127103060938e-01], 
-[1.072267222010324206e+00, 9.367346938775510390e-01, 8.536481784709712972e-01], 
-[1.072267222010324206e+00, 9.387755102040816757e-01, 8.820309440556168834e-01], 
-[1.072267222010324206e+00, 9.408163265306123124e-01, 9.123063519161538348e-01], 
-[1.072267222010324206e+00, 9.428571428571428381e-01, 9.446724077150590038e-01], 
-[1.072267222010324206e+00, 9.448979591836734748e-01, 9.793559265866993435e-01], 
-[1.072267222010324206e+00, 9.469387755102041115e-01, 1.016617992836451823e+00], 
-[1.072267222010324206e+00, 9.489795918367347483e-01, 1.056760713790763084e+00], 
-[1.072267222010324206e+00, 9.510204081632652739e-01, 1.100135641184182056e+00], 
-[1.072267222010324206e+00, 9.530612244897959107e-01, 1.147154362089861213e+00], 
-[1.072267222010324206e+00, 9.551020408163265474e-01, 1.198301942176186019e+00], 
-[1.072267222010324206e+00, 9.571428571428571841e-01, 1.254154161639584597e+00], 
-[1.072267222010324206e+00, 9.591836734693878208e-01, 1.315399856604324569e+00], 
-[1.072267222010324206e+00, 9.612244897959183465e-01, 1.382870226057362428e+00], 
-[1.072267222010324206e+00, 9.632653061224489832e-01, 1.457577782823273438e+00], 
-[1.072267222010324206e+00, 9.653061224489796199e-01, 1.540768874847660230e+00], 
-[1.072267222010324206e+00, 9.673469387755102566e-01, 1.633995646196328977e+00], 
-[1.072267222010324206e+00, 9.693877551020407823e-01, 1.739216405280876732e+00], 
-[1.072267222010324206e+00, 9.714285714285714191e-01, 1.858938438653953806e+00], 
-[1.072267222010324206e+00, 9.734693877551020558e-01, 1.996425856275565680e+00], 
-[1.072267222010324206e+00, 9.755102040816326925e-01, 2.156009949460861552e+00], 
-[1.072267222010324206e+00, 9.775510204081632182e-01, 2.343566503055427575e+00], 
-[1.072267222010324206e+00, 9.795918367346938549e-01, 2.567275479277963512e+00], 
-[1.072267222010324206e+00, 9.816326530612244916e-01, 2.838879905361809897e+00], 
-[1.072267222010324206e+00, 9.836734693877551283e-01, 3.175875061385295961e+00], 
-[1.072267222010324206e+00, 9.857142857142857650e-01, 3.605545691857920509e+00], 
-[1.072267222010324206e+00, 9.877551020408162907e-01, 4.172976851149348576e+00], 
-[1.072267222010324206e+00, 9.897959183673469274e-01, 4.958518546044836661e+00], 
-[1.072267222010324206e+00, 9.918367346938775642e-01, 6.120982764397306042e+00], 
-[1.072267222010324206e+00, 9.938775510204082009e-01, 8.025543634678928839e+00], 
-[1.072267222010324206e+00, 9.959183673469387266e-01, 1.174654423405219283e+01], 
-[1.072267222010324206e+00, 9.979591836734693633e-01, 2.249279507636498465e+01], 
-[1.072267222010324206e+00, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.176811952434999142e+00, 1.000000000000000021e-03, 3.729320586406013882e-02], 
-[1.176811952434999142e+00, 1.148922311909569708e-03, 3.725601268421978307e-02], 
-[1.176811952434999142e+00, 1.320022478803632065e-03, 3.721958251951570928e-02], 
-[1.176811952434999142e+00, 1.516603278119670137e-03, 3.718402928150923298e-02], 
-[1.176811952434999142e+00, 1.742459344546885402e-03, 3.714948409517059014e-02], 
-[1.176811952434999142e+00, 2.001950418545241171e-03, 3.711609796574186909e-02], 
-[1.176811952434999142e+00, 2.300085503203331758e-03, 3.708404487949013006e-02], 
-[1.176811952434999142e+00, 2.642619553930058204e-03, 3.705352541523704302e-02], 
-[1.176811952434999142e+00, 3.036164567398761706e-03, 3.702477095917854066e-02], 
-[1.176811952434999142e+00, 3.488317214113704091e-03, 3.699804863468031391e-02], 
-[1.176811952434999142e+00, 4.007805478313466660e-03, 3.697366708271784819e-02], 
-[1.176811952434999142e+00, 4.604657135827751671e-03, 3.695198325833710939e-02], 
-[1.176811952434999142e+00, 5.290393322046124149e-03, 3.693341044630161357e-02], 
-[1.176811952434999142e+00, 6.078250926476181683e-03, 3.691842774652694809e-02], 
-[1.176811952434999142e+00, 6.983438106813499684e-03, 3.690759134055429658e-02], 
-[1.176811952434999142e+00, 8.023427854757562983e-03, 3.690154792794098082e-02], 
-[1.176811952434999142e+00, 9.218295280327699903e-03, 3.690105082152728838e-02], 
-[1.176811952434999142e+00, 1.059110512533918171e-02, 3.690697932049947366e-02], 
-[1.176811952434999142e+00, 1.216835698628199354e-02, 3.692036214966469554e-02], 
-[1.176811952434999142e+00, 1.398049684082008047e-02, 3.694240597650755298e-02], 
-[1.176811952434999142e+00, 1.606250475199945058e-02, 3.697453031266197815e-02], 
-[1.176811952434999142e+00, 1.845457009472566828e-02, 3.701841049995528016e-02], 
-[1.176811952434999142e+00, 2.120286733852943389e-02, 3.707603100961805176e-02], 
-[1.176811952434999142e+00, 2.436044736169515681e-02, 3.714975199855777288e-02], 
-[1.176811952434999142e+00, 2.798826150195019707e-02, 3.724239304296513009e-02], 
-[1.176811952434999142e+00, 3.215633811115024138e-02, 3.735733931426665072e-02], 
-[1.176811952434999142e+00, 3.694513432520856594e-02, 3.749867733258271940e-02], 
-[1.176811952434999142e+00, 4.244708914272822542e-02, 3.767137006121681897e-02], 
-[1.176811952434999142e+00, 4.876840779169493850e-02, 3.788148484245729142e-02], 
-[1.176811952434999142e+00, 5.603111182818285713e-02, 3.813649305487432778e-02], 
-[1.176811952434999142e+00, 6.437539454049952259e-02, 3.844566822627840802e-02], 
-[1.176811952434999142e+00, 7.396232712556144451e-02, 3.882062097925970123e-02], 
-[1.176811952434999142e+00, 8.497696787531199003e-02, 3.927602674111028980e-02], 
-[1.176811952434999142e+00, 9.763193439036874088e-02, 3.983062912306366277e-02], 
-[1.176811952434999142e+00, 1.121715077759858903e-01, 4.050864419891628959e-02], 
-[1.176811952434999142e+00, 1.288763480443681220e-01, 4.134175890950141097e-02], 
-[1.176811952434999142e+00, 1.480689117455977755e-01, 4.237202898576868798e-02], 
-[1.176811952434999142e+00, 1.701196764046864207e-01, 4.365617242655701891e-02], 
-[1.176811952434999142e+00, 1.954542919161802172e-01, 4.527208980031908331e-02], 
-[1.176811952434999142e+00, 2.245617969409859638e-01, 4.732905555164165778e-02], 
-[1.176811952434999142e+00, 2.580040589080049296e-01, 4.998419678061422761e-02], 
-[1.176811952434999142e+00, 2.964266198426381838e-01, 5.347023968947223205e-02], 
-[1.176811952434999142e+00, 3.405711573811430193e-01, 5.814457829061347310e-02], 
-[1.176811952434999142e+00, 3.912898015080607528e-01, 6.458147114836777780e-02], 
-[1.176811952434999142e+00, 4.495615833752782953e-01, 7.375905873789563583e-02], 
-[1.176811952434999142e+00, 5.165113337172515529e-01, 8.747855160839504429e-02], 
-[1.176811952434999142e+00, 5.934313956619206021e-01, 1.094407205714730824e-01], 
-[1.176811952434999142e+00, 6.818065710636164178e-01, 1.486159939674722430e-01], 
-[1.176811952434999142e+00, 7.833427819015473803e-01, 2.338282111616158121e-01], 
-[1.176811952434999142e+00, 9.000000000000000222e-01, 5.394566056267973142e-01], 
-[1.176811952434999142e+00, 9.020408163265306589e-01, 5.510681934367126500e-01], 
-[1.176811952434999142e+00, 9.040816326530612956e-01, 5.631589118684311446e-01], 
-[1.176811952434999142e+00, 9.061224489795918213e-01, 5.757592734475350804e-01], 
-[1.176811952434999142e+00, 9.081632653061224580e-01, 5.889024550383347156e-01], 
-[1.176811952434999142e+00, 9.102040816326530948e-01, 6.026245963044016829e-01], 
-[1.176811952434999142e+00, 9.122448979591837315e-01, 6.169651393168279485e-01], 
-[1.176811952434999142e+00, 9.142857142857142572e-01, 6.319672160972017450e-01], 
-[1.176811952434999142e+00, 9.163265306122448939e-01, 6.476780921943354752e-01], 
-[1.176811952434999142e+00, 9.183673469387755306e-01, 6.641496759989121701e-01], 
-[1.176811952434999142e+00, 9.204081632653061673e-01, 6.814391054723225594e-01], 
-[1.176811952434999142e+00, 9.224489795918368040e-01, 6.996094264015650932e-01], 
-[1.176811952434999142e+00, 9.244897959183673297e-01, 7.187303793151502695e-01], 
-[1.176811952434999142e+00, 9.265306122448979664e-01, 7.388793159673954225e-01], 
-[1.176811952434999142e+00, 9.285714285714286031e-01, 7.601422710329734933e-01], 
-[1.176811952434999142e+00, 9.306122448979592399e-01, 7.826152206309451298e-01], 
-[1.176811952434999142e+00, 9.326530612244897656e-01, 8.064055668911092045e-01], 
-[1.176811952434999142e+00, 9.346938775510204023e-01, 8.316338974870540746e-01], 
-[1.176811952434999142e+00, 9.367346938775510390e-01, 8.584360815674163536e-01], 
-[1.176811952434999142e+00, 9.387755102040816757e-01, 8.869657797443064595e-01], 
-[1.176811952434999142e+00, 9.408163265306123124e-01, 9.173974670185935931e-01], 
-[1.176811952434999142e+00, 9.428571428571428381e-01, 9.499300955048880502e-01], 
-[1.176811952434999142e+00, 9.448979591836734748e-01, 9.847915610503247263e-01], 
-[1.176811952434999142e+00, 9.469387755102041115e-01, 1.022244187848362573e+00], 
-[1.176811952434999142e+00, 9.489795918367347483e-01, 1.062591513003024790e+00], 
-[1.176811952434999142e+00, 9.510204081632652739e-01, 1.106186746076141869e+00], 
-[1.176811952434999142e+00, 9.530612244897959107e-01, 1.153443407829566114e+00], 
-[1.176811952434999142e+00, 9.551020408163265474e-01, 1.204848833933076957e+00], 
-[1.176811952434999142e+00, 9.571428571428571841e-01, 1.260981488086595270e+00], 
-[1.176811952434999142e+00, 9.591836734693878208e-01, 1.322533403045166533e+00], 
-[1.176811952434999142e+00, 9.612244897959183465e-01, 1.390339617651678905e+00], 
-[1.176811952434999142e+00, 9.632653061224489832e-01, 1.465417299901369041e+00], 
-[1.176811952434999142e+00, 9.653061224489796199e-01, 1.549018499108260283e+00], 
-[1.176811952434999142e+00, 9.673469387755102566e-01, 1.642702421566736515e+00], 
-[1.176811952434999142e+00, 9.693877551020407823e-01, 1.748436235181899390e+00], 
-[1.176811952434999142e+00, 9.714285714285714191e-01, 1.868738500491432308e+00], 
-[1.176811952434999142e+00, 9.734693877551020558e-01, 2.006887908432364753e+00], 
-[1.176811952434999142e+00, 9.755102040816326925e-01, 2.167234961744642696e+00], 
-[1.176811952434999142e+00, 9.775510204081632182e-01, 2.355681307263970847e+00], 
-[1.176811952434999142e+00, 9.795918367346938549e-01, 2.580442608653354952e+00], 
-[1.176811952434999142e+00, 9.816326530612244916e-01, 2.853312670929166295e+00], 
-[1.176811952434999142e+00, 9.836734693877551283e-01, 3.191861644399927034e+00], 
-[1.176811952434999142e+00, 9.857142857142857650e-01, 3.623489677434273304e+00], 
-[1.176811952434999142e+00, 9.877551020408162907e-01, 4.193469969621002491e+00], 
-[1.176811952434999142e+00, 9.897959183673469274e-01, 4.982482590925609856e+00], 
-[1.176811952434999142e+00, 9.918367346938775642e-01, 6.149979579545490793e+00], 
-[1.176811952434999142e+00, 9.938775510204082009e-01, 8.062571711843862232e+00], 
-[1.176811952434999142e+00, 9.959183673469387266e-01, 1.179869115367246657e+01], 
-[1.176811952434999142e+00, 9.979591836734693633e-01, 2.258592355034198462e+01], 
-[1.176811952434999142e+00, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.291549665014884107e+00, 1.000000000000000021e-03, 3.756255897365873286e-02], 
-[1.291549665014884107e+00, 1.148922311909569708e-03, 3.752482173545932526e-02], 
-[1.291549665014884107e+00, 1.320022478803632065e-03, 3.748785255559999863e-02], 
-[1.291549665014884107e+00, 1.516603278119670137e-03, 3.745176609288271979e-02], 
-[1.291549665014884107e+00, 1.742459344546885402e-03, 3.741669433160568076e-02], 
-[1.291549665014884107e+00, 2.001950418545241171e-03, 3.738278926567685512e-02], 
-[1.291549665014884107e+00, 2.300085503203331758e-03, 3.735022601940489462e-02], 
-[1.291549665014884107e+00, 2.642619553930058204e-03, 3.731920648235070165e-02], 
-[1.291549665014884107e+00, 3.036164567398761706e-03, 3.728996355134382018e-02], 
-[1.291549665014884107e+00, 3.488317214113704091e-03, 3.726276609206659318e-02], 
-[1.291549665014884107e+00, 4.007805478313466660e-03, 3.723792475673746993e-02], 
-[1.291549665014884107e+00, 4.604657135827751671e-03, 3.721579882433467823e-02], 
-[1.291549665014884107e+00, 5.290393322046124149e-03, 3.719680426781762916e-02], 
-[1.291549665014884107e+00, 6.078250926476181683e-03, 3.718142330055080463e-02], 
-[1.291549665014884107e+00, 6.983438106813499684e-03, 3.717021571516715417e-02], 
-[1.291549665014884107e+00, 8.023427854757562983e-03, 3.716383240622828099e-02], 
-[1.291549665014884107e+00, 9.218295280327699903e-03, 3.716303156875656183e-02], 
-[1.291549665014884107e+00, 1.059110512533918171e-02, 3.716869819549326742e-02], 
-[1.291549665014884107e+00, 1.216835698628199354e-02, 3.718186766631408069e-02], 
-[1.291549665014884107e+00, 1.398049684082008047e-02, 3.720375444778595969e-02], 
-[1.291549665014884107e+00, 1.606250475199945058e-02, 3.723578721777993233e-02], 
-[1.291549665014884107e+00, 1.845457009472566828e-02, 3.727965212604942430e-02], 
-[1.291549665014884107e+00, 2.120286733852943389e-02, 3.733734643343657178e-02], 
-[1.291549665014884107e+00, 2.436044736169515681e-02, 3.741124549215089912e-02], 
-[1.291549665014884107e+00, 2.798826150195019707e-02, 3.750418701203148825e-02], 
-[1.291549665014884107e+00, 3.215633811115024138e-02, 3.761957791082315428e-02], 
-[1.291549665014884107e+00, 3.694513432520856594e-02, 3.776153092824429541e-02], 
-[1.291549665014884107e+00, 4.244708914272822542e-02, 3.793504082829650403e-02], 
-[1.291549665014884107e+00, 4.876840779169493850e-02, 3.814621377401016672e-02], 
-[1.291549665014884107e+00, 5.603111182818285713e-02, 3.840256887189978652e-02], 
-[1.291549665014884107e+00, 6.437539454049952259e-02, 3.871343878545328854e-02], 
-[1.291549665014884107e+00, 7.396232712556144451e-02, 3.909050803087103787e-02], 
-[1.291549665014884107e+00, 8.497696787531199003e-02, 3.954854522994034893e-02], 
-[1.291549665014884107e+00, 9.763193439036874088e-02, 4.010641273150652303e-02], 
-[1.291549665014884107e+00, 1.121715077759858903e-01, 4.078847959352089464e-02], 
-[1.291549665014884107e+00, 1.288763480443681220e-01, 4.162663232253236562e-02], 
-[1.291549665014884107e+00, 1.480689117455977755e-01, 4.266319060446543965e-02], 
-[1.291549665014884107e+00, 1.701196764046864207e-01, 4.395522703820428645e-02], 
-[1.291549665014884107e+00, 1.954542919161802172e-01, 4.558112710092829256e-02], 
-[1.291549665014884107e+00, 2.245617969409859638e-01, 4.765084209337729082e-02], 
-[1.291549665014884107e+00, 2.580040589080049296e-01, 5.032246695935804759e-02], 
-[1.291549665014884107e+00, 2.964266198426381838e-01, 5.383015234059784770e-02], 
-[1.291549665014884107e+00, 3.405711573811430193e-01, 5.853346391675259136e-02], 
-[1.291549665014884107e+00, 3.912898015080607528e-01, 6.501012055466266759e-02], 
-[1.291549665014884107e+00, 4.495615833752782953e-01, 7.424409924986236087e-02], 
-[1.291549665014884107e+00, 5.165113337172515529e-01, 8.804723375348336156e-02], 
-[1.291549665014884107e+00, 5.934313956619206021e-01, 1.101418124701100676e-01], 
-[1.291549665014884107e+00, 6.818065710636164178e-01, 1.495494788562356236e-01], 
-[1.291549665014884107e+00, 7.833427819015473803e-01, 2.352545070374344460e-01], 
-[1.291549665014884107e+00, 9.000000000000000222e-01, 5.425643396041622823e-01], 
-[1.291549665014884107e+00, 9.020408163265306589e-01, 5.542379618455604007e-01], 
-[1.291549665014884107e+00, 9.040816326530612956e-01, 5.663931606491733328e-01], 
-[1.291549665014884107e+00, 9.061224489795918213e-01, 5.790605995003929030e-01], 
-[1.291549665014884107e+00, 9.081632653061224580e-01, 5.922736190923012511e-01], 
-[1.291549665014884107e+00, 9.102040816326530948e-01, 6.060685371996812343e-01], 
-[1.291549665014884107e+00, 9.122448979591837315e-01, 6.204849898923752161e-01], 
-[1.291549665014884107e+00, 9.142857142857142572e-01, 6.355663209061209740e-01], 
-[1.291549665014884107e+00, 9.163265306122448939e-01, 6.513600273069912738e-01], 
-[1.291549665014884107e+00, 9.183673469387755306e-01, 6.679182711979356757e-01], 
-[1.291549665014884107e+00, 9.204081632653061673e-01, 6.852984691969256081e-01], 
-[1.291549665014884107e+00, 9.224489795918368040e-01, 7.035639738627603723e-01], 
-[1.291549665014884107e+00, 9.244897959183673297e-01, 7.227848642812192415e-01], 
-[1.291549665014884107e+00, 9.265306122448979664e-01, 7.430388668135867736e-01], 
-[1.291549665014884107e+00, 9.285714285714286031e-01, 7.644124317651894707e-01], 
-[1.291549665014884107e+00, 9.306122448979592399e-01, 7.870019977355697804e-01], 
-[1.291549665014884107e+00, 9.326530612244897656e-01, 8.109154830392684143e-01], 
-[1.291549665014884107e+00, 9.346938775510204023e-01, 8.362740533407484467e-01], 
-[1.291549665014884107e+00, 9.367346938775510390e-01, 8.632142272093721314e-01], 
-[1.291549665014884107e+00, 9.387755102040816757e-01, 8.918903975992774624e-01], 
-[1.291549665014884107e+00, 9.408163265306123124e-01, 9.224778685729260186e-01], 
-[1.291549665014884107e+00, 9.428571428571428381e-01, 9.551765346927496569e-01], 
-[1.291549665014884107e+00, 9.448979591836734748e-01, 9.902153678990743835e-01], 
-[1.291549665014884107e+00, 9.469387755102041115e-01, 1.027857926917111087e+00], 
-[1.291549665014884107e+00, 9.489795918367347483e-01, 1.068409172384143790e+00], 
-[1.291549665014884107e+00, 9.510204081632652739e-01, 1.112223964367163420e+00], 
-[1.291549665014884107e+00, 9.530612244897959107e-01, 1.159717748676467597e+00], 
-[1.291549665014884107e+00, 9.551020408163265474e-01, 1.211380120717671538e+00], 
-[1.291549665014884107e+00, 9.571428571428571841e-01, 1.267792215406690293e+00], 
-[1.291549665014884107e+00, 9.591836734693878208e-01, 1.329649247301971648e+00], 
-[1.291549665014884107e+00, 9.612244897959183465e-01, 1.397790077050471202e+00], 
-[1.291549665014884107e+00, 9.632653061224489832e-01, 1.473236505624677672e+00], 
-[1.291549665014884107e+00, 9.653061224489796199e-01, 1.557246256125345063e+00], 
-[1.291549665014884107e+00, 9.673469387755102566e-01, 1.651385562382701400e+00], 
-[1.291549665014884107e+00, 9.693877551020407823e-01, 1.757630407567393860e+00], 
-[1.291549665014884107e+00, 9.714285714285714191e-01, 1.878510568957493909e+00], 
-[1.291549665014884107e+00, 9.734693877551020558e-01, 2.017319243089587211e+00], 
-[1.291549665014884107e+00, 9.755102040816326925e-01, 2.178426042900284632e+00], 
-[1.291549665014884107e+00, 9.775510204081632182e-01, 2.367758338138468144e+00], 
-[1.291549665014884107e+00, 9.795918367346938549e-01, 2.593567297670030580e+00], 
-[1.291549665014884107e+00, 9.816326530612244916e-01, 2.867697218487150757e+00], 
-[1.291549665014884107e+00, 9.836734693877551283e-01, 3.207792688666335934e+00], 
-[1.291549665014884107e+00, 9.857142857142857650e-01, 3.641368574529253443e+00], 
-[1.291549665014884107e+00, 9.877551020408162907e-01, 4.213885066309227767e+00], 
-[1.291549665014884107e+00, 9.897959183673469274e-01, 5.006350196481232473e+00], 
-[1.291549665014884107e+00, 9.918367346938775642e-01, 6.178851802419011996e+00], 
-[1.291549665014884107e+00, 9.938775510204082009e-01, 8.099427256910059825e+00], 
-[1.291549665014884107e+00, 9.959183673469387266e-01, 1.185056719203327980e+01], 
-[1.291549665014884107e+00, 9.979591836734693633e-01, 2.267847625445569548e+01], 
-[1.291549665014884107e+00, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.417474162926806169e+00, 1.000000000000000021e-03, 3.783227445171073733e-02], 
-[1.417474162926806169e+00, 1.148922311909569708e-03, 3.779398889555050933e-02], 
-[1.417474162926806169e+00, 1.320022478803632065e-03, 3.775647644157487798e-02], 
-[1.417474162926806169e+00, 1.516603278119670137e-03, 3.771985249590428801e-02], 
-[1.417474162926806169e+00, 1.742459344546885402e-03, 3.768424990217342924e-02], 
-[1.417474162926806169e+00, 2.001950418545241171e-03, 3.764982164297252937e-02], 
-[1.417474162926806169e+00, 2.300085503203331758e-03, 3.761674398065723013e-02], 
-[1.417474162926806169e+00, 2.642619553930058204e-03, 3.758522011552982434e-02], 
-[1.417474162926806169e+00, 3.036164567398761706e-03, 3.755548445499098942e-02], 
-[1.417474162926806169e+00, 3.488317214113704091e-03, 3.752780760702095764e-02], 
-[1.417474162926806169e+00, 4.007805478313466660e-03, 3.750250223498547558e-02], 
-[1.417474162926806169e+00, 4.604657135827751671e-03, 3.747992994167090308e-02], 
-[1.417474162926806169e+00, 5.290393322046124149e-03, 3.746050938805828290e-02], 
-[1.417474162926806169e+00, 6.078250926476181683e-03, 3.744472590072377149e-02], 
-[1.417474162926806169e+00, 6.983438106813499684e-03, 3.743314288307622584e-02], 
-[1.417474162926806169e+00, 8.023427854757562983e-03, 3.742641542426738271e-02], 
-[1.417474162926806169e+00, 9.218295280327699903e-03, 3.742530660096488049e-02], 
-[1.417474162926806169e+00, 1.059110512533918171e-02, 3.743070709877490548e-02], 
-[1.417474162926806169e+00, 1.216835698628199354e-02, 3.744365895175981451e-02], 
-[1.417474162926806169e+00, 1.398049684082008047e-02, 3.746538442444651701e-02], 
-[1.417474162926806169e+00, 1.606250475199945058e-02, 3.749732135951773515e-02], 
-[1.417474162926806169e+00, 1.845457009472566828e-02, 3.754116671284399298e-02], 
-[1.417474162926806169e+00, 2.120286733852943389e-02, 3.759893053258181461e-02], 
-[1.417474162926806169e+00, 2.436044736169515681e-02, 3.767300336331971811e-02], 
-[1.417474162926806169e+00, 2.798826150195019707e-02, 3.776624104481372812e-02], 
-[1.417474162926806169e+00, 3.215633811115024138e-02, 3.788207223634090792e-02], 
-[1.417474162926806169e+00, 3.694513432520856594e-02, 3.802463589105134489e-02], 
-[1.417474162926806169e+00, 4.244708914272822542e-02, 3.819895856562959685e-02], 
-[1.417474162926806169e+00, 4.876840779169493850e-02, 3.841118523336564672e-02], 
-[1.417474162926806169e+00, 5.603111182818285713e-02, 3.866888271487529949e-02], 
-[1.417474162926806169e+00, 6.437539454049952259e-02, 3.898144279086242225e-02], 
-[1.417474162926806169e+00, 7.396232712556144451e-02, 3.936062384624548077e-02], 
-[1.417474162926806169e+00, 8.497696787531199003e-02, 3.982128766334261383e-02], 
-[1.417474162926806169e+00, 9.763193439036874088e-02, 4.038241528166648664e-02], 
-[1.417474162926806169e+00, 1.121715077759858903e-01, 4.106852867752823488e-02], 
-[1.417474162926806169e+00, 1.288763480443681220e-01, 4.191171382957389890e-02], 
-[1.417474162926806169e+00, 1.480689117455977755e-01, 4.295455424328123439e-02], 
-[1.417474162926806169e+00, 1.701196764046864207e-01, 4.425447691809340778e-02], 
-[1.417474162926806169e+00, 1.954542919161802172e-01, 4.589035194001670620e-02], 
-[1.417474162926806169e+00, 2.245617969409859638e-01, 4.797280700452193070e-02], 
-[1.417474162926806169e+00, 2.580040589080049296e-01, 5.066090416985526146e-02], 
-[1.417474162926806169e+00, 2.964266198426381838e-01, 5.419021732728881990e-02], 
-[1.417474162926806169e+00, 3.405711573811430193e-01, 5.892248180552471515e-02], 
-[1.417474162926806169e+00, 3.912898015080607528e-01, 6.543887318170051037e-02], 
-[1.417474162926806169e+00, 4.495615833752782953e-01, 7.472919816849038499e-02], 
-[1.417474162926806169e+00, 5.165113337172515529e-01, 8.861589971995795234e-02], 
-[1.417474162926806169e+00, 5.934313956619206021e-01, 1.108427514648965273e-01], 
-[1.417474162926806169e+00, 6.818065710636164178e-01, 1.504825226854982212e-01], 
-[1.417474162926806169e+00, 7.833427819015473803e-01, 2.366795889302222844e-01], 
-[1.417474162926806169e+00, 9.000000000000000222e-01, 5.456671265113475222e-01], 
-[1.417474162926806169e+00, 9.020408163265306589e-01, 5.574026213358620474e-01], 
-[1.417474162926806169e+00, 9.040816326530612956e-01, 5.696221307770439335e-01], 
-[1.417474162926806169e+00, 9.061224489795918213e-01, 5.823564687291551412e-01], 
-[1.417474162926806169e+00, 9.081632653061224580e-01, 5.956391391119317813e-01], 
-[1.417474162926806169e+00, 9.102040816326530948e-01, 6.095066371520699855e-01], 
-[1.417474162926806169e+00, 9.122448979591837315e-01, 6.239987921948204619e-01], 
-[1.417474162926806169e+00, 9.142857142857142572e-01, 6.391591588948248859e-01], 
-[1.417474162926806169e+00, 9.163265306122448939e-01, 6.550354649592219358e-01], 
-[1.417474162926806169e+00, 9.183673469387755306e-01, 6.716801252356519036e-01], 
-[1.417474162926806169e+00, 9.204081632653061673e-01, 6.891508339276373185e-01], 
-[1.417474162926806169e+00, 9.224489795918368040e-01, 7.075112491772681533e-01], 
-[1.417474162926806169e+00, 9.244897959183673297e-01, 7.268317873052465572e-01], 
-[1.417474162926806169e+00, 9.265306122448979664e-01, 7.471905478045173243e-01], 
-[1.417474162926806169e+00, 9.285714285714286031e-01, 7.686743949602631298e-01], 
-[1.417474162926806169e+00, 9.306122448979592399e-01, 7.913802279996973166e-01], 
-[1.417474162926806169e+00, 9.326530612244897656e-01, 8.154164793357694396e-01], 
-[1.417474162926806169e+00, 9.346938775510204023e-01, 8.409048902664357783e-01], 
-[1.417474162926806169e+00, 9.367346938775510390e-01, 8.679826261084071515e-01], 
-[1.417474162926806169e+00, 9.387755102040816757e-01, 8.968048091143409062e-01], 
-[1.417474162926806169e+00, 9.408163265306123124e-01, 9.275475689290781922e-01], 
-[1.417474162926806169e+00, 9.428571428571428381e-01, 9.604117385680327468e-01], 
-[1.417474162926806169e+00, 9.448979591836734748e-01, 9.956273614561997887e-01], 
-[1.417474162926806169e+00, 9.469387755102041115e-01, 1.033459225507192603e+00], 
-[1.417474162926806169e+00, 9.489795918367347483e-01, 1.074213708662554723e+00], 
-[1.417474162926806169e+00, 9.510204081632652739e-01, 1.118247314190506936e+00], 
-[1.417474162926806169e+00, 9.530612244897959107e-01, 1.165977404331285605e+00], 
-[1.417474162926806169e+00, 9.551020408163265474e-01, 1.217895823986974158e+00], 
-[1.417474162926806169e+00, 9.571428571428571841e-01, 1.274586367033763157e+00], 
-[1.417474162926806169e+00, 9.591836734693878208e-01, 1.336747415045015597e+00], 
-[1.417474162926806169e+00, 9.612244897959183465e-01, 1.405221632467956061e+00], 
-[1.417474162926806169e+00, 9.632653061224489832e-01, 1.481035431118896906e+00], 
-[1.417474162926806169e+00, 9.653061224489796199e-01, 1.565452180379353964e+00], 
-[1.417474162926806169e+00, 9.673469387755102566e-01, 1.660045107019492150e+00], 
-[1.417474162926806169e+00, 9.693877551020407823e-01, 1.766798965373082675e+00], 
-[1.417474162926806169e+00, 9.714285714285714191e-01, 1.888254692379344402e+00], 
-[1.417474162926806169e+00, 9.734693877551020558e-01, 2.027719915018828978e+00], 
-[1.417474162926806169e+00, 9.755102040816326925e-01, 2.189583255500553438e+00], 
-[1.417474162926806169e+00, 9.775510204081632182e-01, 2.379797667835845232e+00], 
-[1.417474162926806169e+00, 9.795918367346938549e-01, 2.606649630466838730e+00], 
-[1.417474162926806169e+00, 9.816326530612244916e-01, 2.882033647470954030e+00], 
-[1.417474162926806169e+00, 9.836734693877551283e-01, 3.223668313653139439e+00], 
-[1.417474162926806169e+00, 9.857142857142857650e-01, 3.659182529701516362e+00], 
-[1.417474162926806169e+00, 9.877551020408162907e-01, 4.234222325944437593e+00], 
-[1.417474162926806169e+00, 9.897959183673469274e-01, 5.030121604273169567e+00], 
-[1.417474162926806169e+00, 9.918367346938775642e-01, 6.207599766017180443e+00], 
-[1.417474162926806169e+00, 9.938775510204082009e-01, 8.136110768429151818e+00], 
-[1.417474162926806169e+00, 9.959183673469387266e-01, 1.190217321507147830e+01], 
-[1.417474162926806169e+00, 9.979591836734693633e-01, 2.277045533483580186e+01], 
-[1.417474162926806169e+00, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.555676143930472266e+00, 1.000000000000000021e-03, 3.810235254571982949e-02], 
-[1.555676143930472266e+00, 1.148922311909569708e-03, 3.806351440496428401e-02], 
-[1.555676143930472266e+00, 1.320022478803632065e-03, 3.802545441093550804e-02], 
-[1.555676143930472266e+00, 1.516603278119670137e-03, 3.798828871705080962e-02], 
-[1.555676143930472266e+00, 1.742459344546885402e-03, 3.795215102632133741e-02], 
-[1.555676143930472266e+00, 2.001950418545241171e-03, 3.791719531003424903e-02], 
-[1.555676143930472266e+00, 2.300085503203331758e-03, 3.788359896859577747e-02], 
-[1.555676143930472266e+00, 2.642619553930058204e-03, 3.785156651302620801e-02], 
-[1.555676143930472266e+00, 3.036164567398761706e-03, 3.782133386130293734e-02], 
-[1.555676143930472266e+00, 3.488317214113704091e-03, 3.779317336361218138e-02], 
-[1.555676143930472266e+00, 4.007805478313466660e-03, 3.776739969439159988e-02], 
-[1.555676143930472266e+00, 4.604657135827751671e-03, 3.774437678010797437e-02], 
-[1.555676143930472266e+00, 5.290393322046124149e-03, 3.772452596958549009e-02], 
-[1.555676143930472266e+00, 6.078250926476181683e-03, 3.770833570237007437e-02], 
-[1.555676143930472266e+00, 6.983438106813499684e-03, 3.769637299232503347e-02], 
-[1.555676143930472266e+00, 8.023427854757562983e-03, 3.768929712277177546e-02], 
-[1.555676143930472266e+00, 9.218295280327699903e-03, 3.768787605147891351e-02], 
-[1.555676143930472266e+00, 1.059110512533918171e-02, 3.769300615621896250e-02], 
-[1.555676143930472266e+00, 1.216835698628199354e-02, 3.770573612434925670e-02], 
-[1.555676143930472266e+00, 1.398049684082008047e-02, 3.772729601722264042e-02], 
-[1.555676143930472266e+00, 1.606250475199945058e-02, 3.775913284089459782e-02], 
-[1.555676143930472266e+00, 1.845457009472566828e-02, 3.780295435552806504e-02], 
-[1.555676143930472266e+00, 2.120286733852943389e-02, 3.786078339427821626e-02], 
-[1.555676143930472266e+00, 2.436044736169515681e-02, 3.793502569116778689e-02], 
-[1.555676143930472266e+00, 2.798826150195019707e-02, 3.802855521211255529e-02], 
-[1.555676143930472266e+00, 3.215633811115024138e-02, 3.814482235310640013e-02], 
-[1.555676143930472266e+00, 3.694513432520856594e-02, 3.828799227452442389e-02], 
-[1.555676143930472266e+00, 4.244708914272822542e-02, 3.846312331767930137e-02], 
-[1.555676143930472266e+00, 4.876840779169493850e-02, 3.867639925558415820e-02], 
-[1.555676143930472266e+00, 5.603111182818285713e-02, 3.893543460904949627e-02], 
-[1.555676143930472266e+00, 6.437539454049952259e-02, 3.924968025745594058e-02], 
-[1.555676143930472266e+00, 7.396232712556144451e-02, 3.963096842945297571e-02], 
-[1.555676143930472266e+00, 8.497696787531199003e-02, 4.009425403380784125e-02], 
-[1.555676143930472266e+00, 9.763193439036874088e-02, 4.065863675361040819e-02], 
-[1.555676143930472266e+00, 1.121715077759858903e-01, 4.134879141755409826e-02], 
-[1.555676143930472266e+00, 1.288763480443681220e-01, 4.219700338253355720e-02], 
-[1.555676143930472266e+00, 1.480689117455977755e-01, 4.324611983786567915e-02], 
-[1.555676143930472266e+00, 1.701196764046864207e-01, 4.455392198369136081e-02], 
-[1.555676143930472266e+00, 1.954542919161802172e-01, 4.619976421445974590e-02], 
-[1.555676143930472266e+00, 2.245617969409859638e-01, 4.829495015832051263e-02], 
-[1.555676143930472266e+00, 2.580040589080049296e-01, 5.099950825785823372e-02], 
-[1.555676143930472266e+00, 2.964266198426381838e-01, 5.455043446286815534e-02], 
-[1.555676143930472266e+00, 3.405711573811430193e-01, 5.931163173150229284e-02], 
-[1.555676143930472266e+00, 3.912898015080607528e-01, 6.586772875727978094e-02], 
-[1.555676143930472266e+00, 4.495615833752782953e-01, 7.521435516499555551e-02], 
-[1.555676143930472266e+00, 5.165113337172515529e-01, 8.918454911200165980e-02], 
-[1.555676143930472266e+00, 5.934313956619206021e-01, 1.115435370885146660e-01], 
-[1.555676143930472266e+00, 6.818065710636164178e-01, 1.514151249517070863e-01], 
-[1.555676143930472266e+00, 7.833427819015473803e-01, 2.381034565916406720e-01], 
-[1.555676143930472266e+00, 9.000000000000000222e-01, 5.487649698098099327e-01], 
-[1.555676143930472266e+00, 9.020408163265306589e-01, 5.605621755797318695e-01], 
-[1.555676143930472266e+00, 9.040816326530612956e-01, 5.728458261482078928e-01], 
-[1.555676143930472266e+00, 9.061224489795918213e-01, 5.856468852685180471e-01], 
-[1.555676143930472266e+00, 9.081632653061224580e-01, 5.989990194861335437e-01], 
-[1.555676143930472266e+00, 9.102040816326530948e-01, 6.129389008216883372e-01], 
-[1.555676143930472266e+00, 9.122448979591837315e-01, 6.275065511739690294e-01], 
-[1.555676143930472266e+00, 9.142857142857142572e-01, 6.427457353229024672e-01], 
-[1.555676143930472266e+00, 9.163265306122448939e-01, 6.587044107423073447e-01], 
-[1.555676143930472266e+00, 9.183673469387755306e-01, 6.754352440589586060e-01], 
-[1.555676143930472266e+00, 9.204081632653061673e-01, 6.929962059931558116e-01], 
-[1.555676143930472266e+00, 9.224489795918368040e-01, 7.114512590842962947e-01], 
-[1.555676143930472266e+00, 9.244897959183673297e-01, 7.308711555685063477e-01], 
-[1.555676143930472266e+00, 9.265306122448979664e-01, 7.513343665982654684e-01], 
-[1.555676143930472266e+00, 9.285714285714286031e-01, 7.729281687914533183e-01], 
-[1.555676143930472266e+00, 9.306122448979592399e-01, 7.957499201542408418e-01], 
-[1.555676143930472266e+00, 9.326530612244897656e-01, 8.199085651163229294e-01], 
-[1.555676143930472266e+00, 9.346938775510204023e-01, 8.455264182571028408e-01], 
-[1.555676143930472266e+00, 9.367346938775510390e-01, 8.727412889733779933e-01], 
-[1.555676143930472266e+00, 9.387755102040816757e-01, 9.017090257798578978e-01], 
-[1.555676143930472266e+00, 9.408163265306123124e-01, 9.326065804326904018e-01], 
-[1.555676143930472266e+00, 9.428571428571428381e-01, 9.656357204148873219e-01], 
-[1.555676143930472266e+00, 9.448979591836734748e-01, 1.001027556038631694e+00], 
-[1.555676143930472266e+00, 9.469387755102041115e-01, 1.039048099075543519e+00], 
-[1.555676143930472266e+00, 9.489795918367347483e-01, 1.080005138557717848e+00], 
-[1.555676143930472266e+00, 9.510204081632652739e-01, 1.124256813668831789e+00], 
-[1.555676143930472266e+00, 9.530612244897959107e-01, 1.172222394482265173e+00], 
-[1.555676143930472266e+00, 9.551020408163265474e-01, 1.224395965183340262e+00], 
-[1.555676143930472266e+00, 9.571428571428571841e-01, 1.281363966384523323e+00], 
-[1.555676143930472266e+00, 9.591836734693878208e-01, 1.343827931924437724e+00], 
-[1.555676143930472266e+00, 9.612244897959183465e-01, 1.412634312094741773e+00], 
-[1.555676143930472266e+00, 9.632653061224489832e-01, 1.488814107482003157e+00], 
-[1.555676143930472266e+00, 9.653061224489796199e-01, 1.573636306318115796e+00], 
-[1.555676143930472266e+00, 9.673469387755102566e-01, 1.668681093813885852e+00], 
-[1.555676143930472266e+00, 9.693877551020407823e-01, 1.775941951489076187e+00], 
-[1.555676143930472266e+00, 9.714285714285714191e-01, 1.897970919029853931e+00], 
-[1.555676143930472266e+00, 9.734693877551020558e-01, 2.038089978926554302e+00], 
-[1.555676143930472266e+00, 9.755102040816326925e-01, 2.200706662039522143e+00], 
-[1.555676143930472266e+00, 9.775510204081632182e-01, 2.391799368417037996e+00], 
-[1.555676143930472266e+00, 9.795918367346938549e-01, 2.619689691064150061e+00], 
-[1.555676143930472266e+00, 9.816326530612244916e-01, 2.896322057167397102e+00], 
-[1.555676143930472266e+00, 9.836734693877551283e-01, 3.239488638639688389e+00], 
-[1.555676143930472266e+00, 9.857142857142857650e-01, 3.676931689262588954e+00], 
-[1.555676143930472266e+00, 9.877551020408162907e-01, 4.254481932924250032e+00], 
-[1.555676143930472266e+00, 9.897959183673469274e-01, 5.053797055395430782e+00], 
-[1.555676143930472266e+00, 9.918367346938775642e-01, 6.236223802641632119e+00], 
-[1.555676143930472266e+00, 9.938775510204082009e-01, 8.172622743807428591e+00], 
-[1.555676143930472266e+00, 9.959183673469387266e-01, 1.195351008649291735e+01], 
-[1.555676143930472266e+00, 9.979591836734693633e-01, 2.286186293108067602e+01], 
-[1.555676143930472266e+00, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.707352647470692153e+00, 1.000000000000000021e-03, 3.837279350326024130e-02], 
-[1.707352647470692153e+00, 1.148922311909569708e-03, 3.833339850428765100e-02], 
-[1.707352647470692153e+00, 1.320022478803632065e-03, 3.829478669723937467e-02], 
-[1.707352647470692153e+00, 1.516603278119670137e-03, 3.825707498285743635e-02], 
-[1.707352647470692153e+00, 1.742459344546885402e-03, 3.822039792355098886e-02], 
-[1.707352647470692153e+00, 2.001950418545241171e-03, 3.818491047931736604e-02], 
-[1.707352647470692153e+00, 2.300085503203331758e-03, 3.815079118861509216e-02], 
-[1.707352647470692153e+00, 2.642619553930058204e-03, 3.811824587316912233e-02], 
-[1.707352647470692153e+00, 3.036164567398761706e-03, 3.808751196150037682e-02], 
-[1.707352647470692153e+00, 3.488317214113704091e-03, 3.805886354594274767e-02], 
-[1.707352647470692153e+00, 4.007805478313466660e-03, 3.803261731191520667e-02], 
-[1.707352647470692153e+00, 4.604657135827751671e-03, 3.800913950943357600e-02], 
-[1.707352647470692153e+00, 5.290393322046124149e-03, 3.798885417498263500e-02], 
-[1.707352647470692153e+00, 6.078250926476181683e-03, 3.797225286083125845e-02], 
-[1.707352647470692153e+00, 6.983438106813499684e-03, 3.795990619097039387e-02], 
-[1.707352647470692153e+00, 8.023427854757562983e-03, 3.795247764246414968e-02], 
-[1.707352647470692153e+00, 9.218295280327699903e-03, 3.795074005363055503e-02], 
-[1.707352647470692153e+00, 1.059110512533918171e-02, 3.795559549370129682e-02], 
-[1.707352647470692153e+00, 1.216835698628199354e-02, 3.796809930242698444e-02], 
-[1.707352647470692153e+00, 1.398049684082008047e-02, 3.798948933684095225e-02], 
-[1.707352647470692153e+00, 1.606250475199945058e-02, 3.802122176491902483e-02], 
-[1.707352647470692153e+00, 1.845457009472566828e-02, 3.806501514927609908e-02], 
-[1.707352647470692153e+00, 2.120286733852943389e-02, 3.812290510573177610e-02], 
-[1.707352647470692153e+00, 2.436044736169515681e-02, 3.819731255477643028e-02], 
-[1.707352647470692153e+00, 2.798826150195019707e-02, 3.829112958470264755e-02], 
-[1.707352647470692153e+00, 3.215633811115024138e-02, 3.840782832337517189e-02], 
-[1.707352647470692153e+00, 3.694513432520856594e-02, 3.855160013215093440e-02], 
-[1.707352647470692153e+00, 4.244708914272822542e-02, 3.872753512887223970e-02], 
-[1.707352647470692153e+00, 4.876840779169493850e-02, 3.894185587568638890e-02], 
-[1.707352647470692153e+00, 5.603111182818285713e-02, 3.920222457962824897e-02], 
-[1.707352647470692153e+00, 6.437539454049952259e-02, 3.951815120013858762e-02], 
-[1.707352647470692153e+00, 7.396232712556144451e-02, 3.990154178451576356e-02], 
-[1.707352647470692153e+00, 8.497696787531199003e-02, 4.036744433377727204e-02], 
-[1.707352647470692153e+00, 9.763193439036874088e-02, 4.093507712735450221e-02], 
-[1.707352647470692153e+00, 1.121715077759858903e-01, 4.162926778016334817e-02], 
-[1.707352647470692153e+00, 1.288763480443681220e-01, 4.248250093326886440e-02], 
-[1.707352647470692153e+00, 1.480689117455977755e-01, 4.353788732382073146e-02], 
-[1.707352647470692153e+00, 1.701196764046864207e-01, 4.485356215242206762e-02], 
-[1.707352647470692153e+00, 1.954542919161802172e-01, 4.650936382109709111e-02], 
-[1.707352647470692153e+00, 2.245617969409859638e-01, 4.861727142799364410e-02], 
-[1.707352647470692153e+00, 2.580040589080049296e-01, 5.133827906911365979e-02], 
-[1.707352647470692153e+00, 2.964266198426381838e-01, 5.491080356067765122e-02], 
-[1.707352647470692153e+00, 3.405711573811430193e-01, 5.970091346931527543e-02], 
-[1.707352647470692153e+00, 3.912898015080607528e-01, 6.629668700931548586e-02], 
-[1.707352647470692153e+00, 4.495615833752782953e-01, 7.569956991080215025e-02], 
-[1.707352647470692153e+00, 5.165113337172515529e-01, 8.975318153415445810e-02], 
-[1.707352647470692153e+00, 5.934313956619206021e-01, 1.122441688742567834e-01], 
-[1.707352647470692153e+00, 6.818065710636164178e-01, 1.523472851523809679e-01], 
-[1.707352647470692153e+00, 7.833427819015473803e-01, 2.395261097753214052e-01], 
-[1.707352647470692153e+00, 9.000000000000000222e-01, 5.518578729634142643e-01], 
-[1.707352647470692153e+00, 9.020408163265306589e-01, 5.637166282516066218e-01], 
-[1.707352647470692153e+00, 9.040816326530612956e-01, 5.760642506610555991e-01], 
-[1.707352647470692153e+00, 9.061224489795918213e-01, 5.889318532552929586e-01], 
-[1.707352647470692153e+00, 9.081632653061224580e-01, 6.023532646058031848e-01], 
-[1.707352647470692153e+00, 9.102040816326530948e-01, 6.163653328705072099e-01], 
-[1.707352647470692153e+00, 9.122448979591837315e-01, 6.310082717813187969e-01], 
-[1.707352647470692153e+00, 9.142857142857142572e-01, 6.463260554514556055e-01], 
-[1.707352647470692153e+00, 9.163265306122448939e-01, 6.623668702488408888e-01], 
-[1.707352647470692153e+00, 9.183673469387755306e-01, 6.791836336158417753e-01], 
-[1.707352647470692153e+00, 9.204081632653061673e-01, 6.968345917230134301e-01], 
-[1.707352647470692153e+00, 9.224489795918368040e-01, 7.153840103236028813e-01], 
-[1.707352647470692153e+00, 9.244897959183673297e-01, 7.349029762524932341e-01], 
-[1.707352647470692153e+00, 9.265306122448979664e-01, 7.554703308527807026e-01], 
-[1.707352647470692153e+00, 9.285714285714286031e-01, 7.771737614314859766e-01], 
-[1.707352647470692153e+00, 9.306122448979592399e-01, 8.001110829291258053e-01], 
-[1.707352647470692153e+00, 9.326530612244897656e-01, 8.243917497151393992e-01], 
-[1.707352647470692153e+00, 9.346938775510204023e-01, 8.501386473036579572e-01], 
-[1.707352647470692153e+00, 9.367346938775510390e-01, 8.774902265104103094e-01], 
-[1.707352647470692153e+00, 9.387755102040816757e-01, 9.066030590827187652e-01], 
-[1.707352647470692153e+00, 9.408163265306123124e-01, 9.376549154250946039e-01], 
-[1.707352647470692153e+00, 9.428571428571428381e-01, 9.708484935122043691e-01], 
-[1.707352647470692153e+00, 9.448979591836734748e-01, 1.006415965956958702e+00], 
-[1.707352647470692153e+00, 9.469387755102041115e-01, 1.044624563071521406e+00], 
-[1.707352647470692153e+00, 9.489795918367347483e-01, 1.085783478780097067e+00], 
-[1.707352647470692153e+00, 9.510204081632652739e-01, 1.130252480914175628e+00], 
-[1.707352647470692153e+00, 9.530612244897959107e-01, 1.178452738805151334e+00], 
-[1.707352647470692153e+00, 9.551020408163265474e-01, 1.230880565734453258e+00], 
-[1.707352647470692153e+00, 9.571428571428571841e-01, 1.288125036858486672e+00], 
-[1.707352647470692153e+00, 9.591836734693878208e-01, 1.350890823570231492e+00], 
-[1.707352647470692153e+00, 9.612244897959183465e-01, 1.420028144097812639e+00], 
-[1.707352647470692153e+00, 9.632653061224489832e-01, 1.496572565784247022e+00], 
-[1.707352647470692153e+00, 9.653061224489796199e-01, 1.581798668356836135e+00], 
-[1.707352647470692153e+00, 9.673469387755102566e-01, 1.677293561064162608e+00], 
-[1.707352647470692153e+00, 9.693877551020407823e-01, 1.785059408759864796e+00], 
-[1.707352647470692153e+00, 9.714285714285714191e-01, 1.907659297127564546e+00], 
-[1.707352647470692153e+00, 9.734693877551020558e-01, 2.048429489454105301e+00], 
-[1.707352647470692153e+00, 9.755102040816326925e-01, 2.211796324932598701e+00], 
-[1.707352647470692153e+00, 9.775510204081632182e-01, 2.403763511847039513e+00], 
-[1.707352647470692153e+00, 9.795918367346938549e-01, 2.632687563363931282e+00], 
-[1.707352647470692153e+00, 9.816326530612244916e-01, 2.910562546715026233e+00], 
-[1.707352647470692153e+00, 9.836734693877551283e-01, 3.255253782716247990e+00], 
-[1.707352647470692153e+00, 9.857142857142857650e-01, 3.694616199277123592e+00], 
-[1.707352647470692153e+00, 9.877551020408162907e-01, 4.274664071313885927e+00], 
-[1.707352647470692153e+00, 9.897959183673469274e-01, 5.077376790475248924e+00], 
-[1.707352647470692153e+00, 9.918367346938775642e-01, 6.264724243897438427e+00], 
-[1.707352647470692153e+00, 9.938775510204082009e-01, 8.208963679307966999e+00], 
-[1.707352647470692153e+00, 9.959183673469387266e-01, 1.200457866777735028e+01], 
-[1.707352647470692153e+00, 9.979591836734693633e-01, 2.295270117627343254e+01], 
-[1.707352647470692153e+00, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.873817422860384996e+00, 1.000000000000000021e-03, 3.864359757197656509e-02], 
-[1.873817422860384996e+00, 1.148922311909569708e-03, 3.860364143415704469e-02], 
-[1.873817422860384996e+00, 1.320022478803632065e-03, 3.856447353410624723e-02], 
-[1.873817422860384996e+00, 1.516603278119670137e-03, 3.852621151991744708e-02], 
-[1.873817422860384996e+00, 1.742459344546885402e-03, 3.848899081341808359e-02], 
-[1.873817422860384996e+00, 2.001950418545241171e-03, 3.845296736332723397e-02], 
-[1.873817422860384996e+00, 2.300085503203331758e-03, 3.841832084615564441e-02], 
-[1.873817422860384996e+00, 2.642619553930058204e-03, 3.838525839431750769e-02], 
-[1.873817422860384996e+00, 3.036164567398761706e-03, 3.835401894684167812e-02], 
-[1.873817422860384996e+00, 3.488317214113704091e-03, 3.832487833814873096e-02], 
-[1.873817422860384996e+00, 4.007805478313466660e-03, 3.829815526454517088e-02], 
-[1.873817422860384996e+00, 4.604657135827751671e-03, 3.827421829946086457e-02], 
-[1.873817422860384996e+00, 5.290393322046124149e-03, 3.825349416685445980e-02], 
-[1.873817422860384996e+00, 6.078250926476181683e-03, 3.823647753146627165e-02], 
-[1.873817422860384996e+00, 6.983438106813499684e-03, 3.822374262708857356e-02], 
-[1.873817422860384996e+00, 8.023427854757562983e-03, 3.821595712407647311e-02], 
-[1.873817422860384996e+00, 9.218295280327699903e-03, 3.821389874075688253e-02], 
-[1.873817422860384996e+00, 1.059110512533918171e-02, 3.821847523709887007e-02], 
-[1.873817422860384996e+00, 1.216835698628199354e-02, 3.823074860433472999e-02], 
-[1.873817422860384996e+00, 1.398049684082008047e-02, 3.825196449402124693e-02], 
-[1.873817422860384996e+00, 1.606250475199945058e-02, 3.828358823458876542e-02], 
-[1.873817422860384996e+00, 1.845457009472566828e-02, 3.832734918924786405e-02], 
-[1.873817422860384996e+00, 2.120286733852943389e-02, 3.838529575412995276e-02], 
-[1.873817422860384996e+00, 2.436044736169515681e-02, 3.845986403320461600e-02], 
-[1.873817422860384996e+00, 2.798826150195019707e-02, 3.855396423333257161e-02], 
-[1.873817422860384996e+00, 3.215633811115024138e-02, 3.867109020937299635e-02], 
-[1.873817422860384996e+00, 3.694513432520856594e-02, 3.881545951738500644e-02], 
-[1.873817422860384996e+00, 4.244708914272822542e-02, 3.899219404359838270e-02], 
-[1.873817422860384996e+00, 4.876840779169493850e-02, 3.920755512865314873e-02], 
-[1.873817422860384996e+00, 5.603111182818285713e-02, 3.946925265177461672e-02], 
-[1.873817422860384996e+00, 6.437539454049952259e-02, 3.978685563376957446e-02], 
-[1.873817422860384996e+00, 7.396232712556144451e-02, 4.017234391540835947e-02], 
-[1.873817422860384996e+00, 8.497696787531199003e-02, 4.064085855564270044e-02], 
-[1.873817422860384996e+00, 9.763193439036874088e-02, 4.121173638286432239e-02], 
-[1.873817422860384996e+00, 1.121715077759858903e-01, 4.190995773186999285e-02], 
-[1.873817422860384996e+00, 1.288763480443681220e-01, 4.276820643358729412e-02], 
-[1.873817422860384996e+00, 1.480689117455977755e-01, 4.382985663670072030e-02], 
-[1.873817422860384996e+00, 1.701196764046864207e-01, 4.515339734166620017e-02], 
-[1.873817422860384996e+00, 1.954542919161802172e-01, 4.681915065673262349e-02], 
-[1.873817422860384996e+00, 2.245617969409859638e-01, 4.893977068673756314e-02], 
-[1.873817422860384996e+00, 2.580040589080049296e-01, 5.167721644935684144e-02], 
-[1.873817422860384996e+00, 2.964266198426381838e-01, 5.527132443407779122e-02], 
-[1.873817422860384996e+00, 3.405711573811430193e-01, 6.009032679365110263e-02], 
-[1.873817422860384996e+00, 3.912898015080607528e-01, 6.672574766583906636e-02], 
-[1.873817422860384996e+00, 4.495615833752782953e-01, 7.618484207754289139e-02], 
-[1.873817422860384996e+00, 5.165113337172515529e-01, 9.032179659131331362e-02], 
-[1.873817422860384996e+00, 5.934313956619206021e-01, 1.129446463560249969e-01], 
-[1.873817422860384996e+00, 6.818065710636164178e-01, 1.532790027861095083e-01], 
-[1.873817422860384996e+00, 7.833427819015473803e-01, 2.409475482368638732e-01], 
-[1.873817422860384996e+00, 9.000000000000000222e-01, 5.549458394384179094e-01], 
-[1.873817422860384996e+00, 9.020408163265306589e-01, 5.668659830282299916e-01], 
-[1.873817422860384996e+00, 9.040816326530612956e-01, 5.792774082161868954e-01], 
-[1.873817422860384996e+00, 9.061224489795918213e-01, 5.922113768283905344e-01], 
-[1.873817422860384996e+00, 9.081632653061224580e-01, 6.057018788638126594e-01], 
-[1.873817422860384996e+00, 9.102040816326530948e-01, 6.197859379623318343e-01], 
-[1.873817422860384996e+00, 9.122448979591837315e-01, 6.345039589700423033e-01], 
-[1.873817422860384996e+00, 9.142857142857142572e-01, 6.499001245430837681e-01], 
-[1.873817422860384996e+00, 9.163265306122448939e-01, 6.660228490727118089e-01], 
-[1.873817422860384996e+00, 9.183673469387755306e-01, 6.829252998553574372e-01], 
-[1.873817422860384996e+00, 9.204081632653061673e-01, 7.006659974475591968e-01], 
-[1.873817422860384996e+00, 9.224489795918368040e-01, 7.193095096354689133e-01], 
-[1.873817422860384996e+00, 9.244897959183673297e-01, 7.389272565389165548e-01], 
-[1.873817422860384996e+00, 9.265306122448979664e-01, 7.595984482258635317e-01], 
-[1.873817422860384996e+00, 9.285714285714286031e-01, 7.814111810525338209e-01], 
-[1.873817422860384996e+00, 9.306122448979592399e-01, 8.044637250532680195e-01], 
-[1.873817422860384996e+00, 9.326530612244897656e-01, 8.288660424649081371e-01], 
-[1.873817422860384996e+00, 9.346938775510204023e-01, 8.547415873949097964e-01], 
-[1.873817422860384996e+00, 9.367346938775510390e-01, 8.822294494228752892e-01], 
-[1.873817422860384996e+00, 9.387755102040816757e-01, 9.114869205063214075e-01], 
-[1.873817422860384996e+00, 9.408163265306123124e-01, 9.426925862432919967e-01], 
-[1.873817422860384996e+00, 9.428571428571428381e-01, 9.760500711335924340e-01], 
-[1.873817422860384996e+00, 9.448979591836734748e-01, 1.011792605515402954e+00], 
-[1.873817422860384996e+00, 9.469387755102041115e-01, 1.050188632936881028e+00], 
-[1.873817422860384996e+00, 9.489795918367347483e-01, 1.091548746031136830e+00], 
-[1.873817422860384996e+00, 9.510204081632652739e-01, 1.136234334027926174e+00], 
-[1.873817422860384996e+00, 9.530612244897959107e-01, 1.184668456963165362e+00], 
-[1.873817422860384996e+00, 9.551020408163265474e-01, 1.237349647053300306e+00], 
-[1.873817422860384996e+00, 9.571428571428571841e-01, 1.294869601837945527e+00], 
-[1.873817422860384996e+00, 9.591836734693878208e-01, 1.357936115592212722e+00], 
-[1.873817422860384996e+00, 9.612244897959183465e-01, 1.427403156620510760e+00], 
-[1.873817422860384996e+00, 9.632653061224489832e-01, 1.504310837068124629e+00], 
-[1.873817422860384996e+00, 9.653061224489796199e-01, 1.589939300878075557e+00], 
-[1.873817422860384996e+00, 9.673469387755102566e-01, 1.685882547030089107e+00], 
-[1.873817422860384996e+00, 9.693877551020407823e-01, 1.794151379984318506e+00], 
-[1.873817422860384996e+00, 9.714285714285714191e-01, 1.917319874836689308e+00], 
-[1.873817422860384996e+00, 9.734693877551020558e-01, 2.058738501177716618e+00], 
-[1.873817422860384996e+00, 9.755102040816326925e-01, 2.222852306516547749e+00], 
-[1.873817422860384996e+00, 9.775510204081632182e-01, 2.415690169994941350e+00], 
-[1.873817422860384996e+00, 9.795918367346938549e-01, 2.645643331149815758e+00], 
-[1.873817422860384996e+00, 9.816326530612244916e-01, 2.924755215104230199e+00], 
-[1.873817422860384996e+00, 9.836734693877551283e-01, 3.270963864784154129e+00], 
-[1.873817422860384996e+00, 9.857142857142857650e-01, 3.712236205563148594e+00], 
-[1.873817422860384996e+00, 9.877551020408162907e-01, 4.294768924846566804e+00], 
-[1.873817422860384996e+00, 9.897959183673469274e-01, 5.100861049673702574e+00], 
-[1.873817422860384996e+00, 9.918367346938775642e-01, 6.293101420694210191e+00], 
-[1.873817422860384996e+00, 9.938775510204082009e-01, 8.245134070052708708e+00], 
-[1.873817422860384996e+00, 9.959183673469387266e-01, 1.205537981818310733e+01], 
-[1.873817422860384996e+00, 9.979591836734693633e-01, 2.304297219700021060e+01], 
-[1.873817422860384996e+00, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[2.056512308348653395e+00, 1.000000000000000021e-03, 3.891476499958389235e-02], 
-[2.056512308348653395e+00, 1.148922311909569708e-03, 3.887424343527532550e-02], 
-[2.056512308348653395e+00, 1.320022478803632065e-03, 3.883451515521811614e-02], 
-[2.056512308348653395e+00, 1.516603278119670137e-03, 3.879569855488229635e-02], 
-[2.056512308348653395e+00, 1.742459344546885402e-03, 3.875792991553238254e-02], 
-[2.056512308348653395e+00, 2.001950418545241171e-03, 3.872136617461918034e-02], 
-[2.056512308348653395e+00, 2.300085503203331758e-03, 3.868618814670380518e-02], 
-[2.056512308348653395e+00, 2.642619553930058204e-03, 3.865260427487209743e-02], 
-[2.056512308348653395e+00, 3.036164567398761706e-03, 3.862085500862297988e-02], 
-[2.056512308348653395e+00, 3.488317214113704091e-03, 3.859121792439989401e-02], 
-[2.056512308348653395e+00, 4.007805478313466660e-03, 3.856401372929994797e-02], 
-[2.056512308348653395e+00, 4.604657135827751671e-03, 3.853961332002849710e-02], 
-[2.056512308348653395e+00, 5.290393322046124149e-03, 3.851844610782716866e-02], 
-[2.056512308348653395e+00, 6.078250926476181683e-03, 3.850100986965138139e-02], 
-[2.056512308348653395e+00, 6.983438106813499684e-03, 3.848788244875026021e-02], 
-[2.056512308348653395e+00, 8.023427854757562983e-03, 3.847973570834989365e-02], 
-[2.056512308348653395e+00, 9.218295280327699903e-03, 3.847735224620017769e-02], 
-[2.056512308348653395e+00, 1.059110512533918171e-02, 3.848164551228985819e-02], 
-[2.056512308348653395e+00, 1.216835698628199354e-02, 3.849368414841144309e-02], 
-[2.056512308348653395e+00, 1.398049684082008047e-02, 3.851472159947655349e-02], 
-[2.056512308348653395e+00, 1.606250475199945058e-02, 3.854623235289079963e-02], 
-[2.056512308348653395e+00, 1.845457009472566828e-02, 3.858995657058848089e-02], 
-[2.056512308348653395e+00, 2.120286733852943389e-02, 3.864795542664162253e-02], 
-[2.056512308348653395e+00, 2.436044736169515681e-02, 3.872268020548895462e-02], 
-[2.056512308348653395e+00, 2.798826150195019707e-02, 3.881705922872487335e-02], 
-[2.056512308348653395e+00, 3.215633811115024138e-02, 3.893460807329594819e-02], 
-[2.056512308348653395e+00, 3.694513432520856594e-02, 3.907957048364753966e-02], 
-[2.056512308348653395e+00, 4.244708914272822542e-02, 3.925710010621112633e-02], 
-[2.056512308348653395e+00, 4.876840779169493850e-02, 3.947349704942547388e-02], 
-[2.056512308348653395e+00, 5.603111182818285713e-02, 3.973651885060890815e-02], 
-[2.056512308348653395e+00, 6.437539454049952259e-02, 4.005579357316281508e-02], 
-[2.056512308348653395e+00, 7.396232712556144451e-02, 4.044337482605757372e-02], 
-[2.056512308348653395e+00, 8.497696787531199003e-02, 4.091449669174637704e-02], 
-[2.056512308348653395e+00, 9.763193439036874088e-02, 4.148861450005483092e-02], 
-[2.056512308348653395e+00, 1.121715077759858903e-01, 4.219086123913712294e-02], 
-[2.056512308348653395e+00, 1.288763480443681220e-01, 4.305411983524630448e-02], 
-[2.056512308348653395e+00, 1.480689117455977755e-01, 4.412202771201235302e-02], 
-[2.056512308348653395e+00, 1.701196764046864207e-01, 4.545342746876135376e-02], 
-[2.056512308348653395e+00, 1.954542919161802172e-01, 4.712912461813449638e-02], 
-[2.056512308348653395e+00, 2.245617969409859638e-01, 4.926244780772426335e-02], 
-[2.056512308348653395e+00, 2.580040589080049296e-01, 5.201632024432049917e-02], 
-[2.056512308348653395e+00, 2.964266198426381838e-01, 5.563199689644796053e-02], 
-[2.056512308348653395e+00, 3.405711573811430193e-01, 6.047987147925484863e-02], 
-[2.056512308348653395e+00, 3.912898015080607528e-01, 6.715491045499855094e-02], 
-[2.056512308348653395e+00, 4.495615833752782953e-01, 7.667017133705884835e-02], 
-[2.056512308348653395e+00, 5.165113337172515529e-01, 9.089039388873211556e-02], 
-[2.056512308348653395e+00, 5.934313956619206021e-01, 1.136449690683307978e-01], 
-[2.056512308348653395e+00, 6.818065710636164178e-01, 1.542102773525521053e-01], 
-[2.056512308348653395e+00, 7.833427819015473803e-01, 2.423677717338320048e-01], 
-[2.056512308348653395e+00, 9.000000000000000222e-01, 5.580288727034599106e-01], 
-[2.056512308348653395e+00, 9.020408163265306589e-01, 5.700102435886417185e-01], 
-[2.056512308348653395e+00, 9.040816326530612956e-01, 5.824853027164001995e-01], 
-[2.056512308348653395e+00, 9.061224489795918213e-01, 5.954854601288090965e-01], 
-[2.056512308348653395e+00, 9.081632653061224580e-01, 6.090448666549963530e-01], 
-[2.056512308348653395e+00, 9.102040816326530948e-01, 6.232007207627882073e-01], 
-[2.056512308348653395e+00, 9.122448979591837315e-01, 6.379936176949743132e-01], 
-[2.056512308348653395e+00, 9.142857142857142572e-01, 6.534679478618684589e-01], 
-[2.056512308348653395e+00, 9.163265306122448939e-01, 6.696723528090902100e-01], 
-[2.056512308348653395e+00, 9.183673469387755306e-01, 6.866602487276163291e-01], 
-[2.056512308348653395e+00, 9.204081632653061673e-01, 7.044904294979430492e-01], 
-[2.056512308348653395e+00, 9.224489795918368040e-01, 7.232277637607147369e-01], 
-[2.056512308348653395e+00, 9.244897959183673297e-01, 7.429440036096799371e-01], 
-[2.056512308348653395e+00, 9.265306122448979664e-01, 7.637187263751494815e-01], 
-[2.056512308348653395e+00, 9.285714285714286031e-01, 7.856404358261981358e-01], 
-[2.056512308348653395e+00, 9.306122448979592399e-01, 8.088078552545574507e-01], 
-[2.056512308348653395e+00, 9.326530612244897656e-01, 8.333314526967777747e-01], 
-[2.056512308348653395e+00, 9.346938775510204023e-01, 8.593352485175473898e-01], 
-[2.056512308348653395e+00, 9.367346938775510390e-01, 8.869589684113714512e-01], 
-[2.056512308348653395e+00, 9.387755102040816757e-01, 9.163606215305505343e-01], 
-[2.056512308348653395e+00, 9.408163265306123124e-01, 9.477196052199329257e-01], 
-[2.056512308348653395e+00, 9.428571428571428381e-01, 9.812404665473571930e-01], 
-[2.056512308348653395e+00, 9.448979591836734748e-01, 1.017157489011799365e+00], 
-[2.056512308348653395e+00, 9.469387755102041115e-01, 1.055740324105752803e+00], 
-[2.056512308348653395e+00, 9.489795918367347483e-01, 1.097300957003241484e+00], 
-[2.056512308348653395e+00, 9.510204081632652739e-01, 1.142202391100807235e+00], 
-[2.056512308348653395e+00, 9.530612244897959107e-01, 1.190869568606987006e+00], 
-[2.056512308348653395e+00, 9.551020408163265474e-01, 1.243803230538154114e+00], 
-[2.056512308348653395e+00, 9.571428571428571841e-01, 1.301597684687952672e+00], 
-[2.056512308348653395e+00, 9.591836734693878208e-01, 1.364963833580006280e+00], 
-[2.056512308348653395e+00, 9.612244897959183465e-01, 1.434759377782499623e+00], 
-[2.056512308348653395e+00, 9.632653061224489832e-01, 1.512028952348369870e+00], 
-[2.056512308348653395e+00, 9.653061224489796199e-01, 1.598058238231751416e+00], 
-[2.056512308348653395e+00, 9.673469387755102566e-01, 1.694448089932915291e+00], 
-[2.056512308348653395e+00, 9.693877551020407823e-01, 1.803217907915682039e+00], 
-[2.056512308348653395e+00, 9.714285714285714191e-01, 1.926952700267119845e+00], 
-[2.056512308348653395e+00, 9.734693877551020558e-01, 2.069017068608532739e+00], 
-[2.056512308348653395e+00, 9.755102040816326925e-01, 2.233874669049531025e+00], 
-[2.056512308348653395e+00, 9.775510204081632182e-01, 2.427579414633985078e+00], 
-[2.056512308348653395e+00, 9.795918367346938549e-01, 2.658557078087186998e+00], 
-[2.056512308348653395e+00, 9.816326530612244916e-01, 2.938900161177365966e+00], 
-[2.056512308348653395e+00, 9.836734693877551283e-01, 3.286619003556005225e+00], 
-[2.056512308348653395e+00, 9.857142857142857650e-01, 3.729791853692366210e+00], 
-[2.056512308348653395e+00, 9.877551020408162907e-01, 4.314796676923940311e+00], 
-[2.056512308348653395e+00, 9.897959183673469274e-01, 5.124250072686396429e+00], 
-[2.056512308348653395e+00, 9.918367346938775642e-01, 6.321355663247193668e+00], 
-[2.056512308348653395e+00, 9.938775510204082009e-01, 8.281134410024602488e+00], 
-[2.056512308348653395e+00, 9.959183673469387266e-01, 1.210591439475183684e+01], 
-[2.056512308348653395e+00, 9.979591836734693633e-01, 2.313267811336633883e+01], 
-[2.056512308348653395e+00, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[2.257019719633921451e+00, 1.000000000000000021e-03, 3.918629603386766802e-02], 
-[2.257019719633921451e+00, 1.148922311909569708e-03, 3.914520474841152314e-02], 
-[2.257019719633921451e+00, 1.320022478803632065e-03, 3.910491179431919984e-02], 
-[2.257019719633921451e+00, 1.516603278119670137e-03, 3.906553631446153807e-02], 
-[2.257019719633921451e+00, 1.742459344546885402e-03, 3.902721544955763122e-02], 
-[2.257019719633921451e+00, 2.001950418545241171e-03, 3.899010712579846494e-02], 
-[2.257019719633921451e+00, 2.300085503203331758e-03, 3.895439329579171439e-02], 
-[2.257019719633921451e+00, 2.642619553930058204e-03, 3.892028371327538316e-02], 
-[2.257019719633921451e+00, 3.036164567398761706e-03, 3.888802033817804343e-02], 
-[2.257019719633921451e+00, 3.488317214113704091e-03, 3.885788248889950058e-02], 
-[2.257019719633921451e+00, 4.007805478313466660e-03, 3.883019288322743512e-02], 
-[2.257019719633921451e+00, 4.604657135827751671e-03, 3.880532474100049922e-02], 
-[2.257019719633921451e+00, 5.290393322046124149e-03, 3.878371016054821957e-02], 
-[2.257019719633921451e+00, 6.078250926476181683e-03, 3.876585003078008435e-02], 
-[2.257019719633921451e+00, 6.983438106813499684e-03, 3.875232580405858773e-02], 
-[2.257019719633921451e+00, 8.023427854757562983e-03, 3.874381353603474631e-02], 
-[2.257019719633921451e+00, 9.218295280327699903e-03, 3.874110070330782918e-02], 
-[2.257019719633921451e+00, 1.059110512533918171e-02, 3.874510644515349878e-02], 
-[2.257019719633921451e+00, 1.216835698628199354e-02, 3.875690605299307590e-02], 
-[2.257019719633921451e+00, 1.398049684082008047e-02, 3.877776076391296900e-02], 
-[2.257019719633921451e+00, 1.606250475199945058e-02, 3.880915422280126204e-02], 
-[2.257019719633921451e+00, 1.845457009472566828e-02, 3.885283738842831153e-02], 
-[2.257019719633921451e+00, 2.120286733852943389e-02, 3.891088421041712792e-02], 
-[2.257019719633921451e+00, 2.436044736169515681e-02, 3.898576115064367187e-02], 
-[2.257019719633921451e+00, 2.798826150195019707e-02, 3.908041464157591127e-02], 
-[2.257019719633921451e+00, 3.215633811115024138e-02, 3.919838197731034118e-02], 
-[2.257019719633921451e+00, 3.694513432520856594e-02, 3.934393308432612008e-02], 
-[2.257019719633921451e+00, 4.244708914272822542e-02, 3.952225336102714592e-02], 
-[2.257019719633921451e+00, 4.876840779169493850e-02, 3.973968167290452269e-02], 
-[2.257019719633921451e+00, 5.603111182818285713e-02, 4.000402320120859806e-02], 
-[2.257019719633921451e+00, 6.437539454049952259e-02, 4.032496503308658636e-02], 
-[2.257019719633921451e+00, 7.396232712556144451e-02, 4.071463452034244923e-02], 
-[2.257019719633921451e+00, 8.497696787531199003e-02, 4.118835873438102257e-02], 
-[2.257019719633921451e+00, 9.763193439036874088e-02, 4.176571145879033609e-02], 
-[2.257019719633921451e+00, 1.121715077759858903e-01, 4.247197826837688373e-02], 
-[2.257019719633921451e+00, 1.288763480443681220e-01, 4.334024108995328944e-02], 
-[2.257019719633921451e+00, 1.480689117455977755e-01, 4.441440048521472228e-02], 
-[2.257019719633921451e+00, 1.701196764046864207e-01, 4.575365245100194989e-02], 
-[2.257019719633921451e+00, 1.954542919161802172e-01, 4.743928560203510003e-02], 
-[2.257019719633921451e+00, 2.245617969409859638e-01, 4.958530266410137582e-02], 
-[2.257019719633921451e+00, 2.580040589080049296e-01, 5.235559029972877698e-02], 
-[2.257019719633921451e+00, 2.964266198426381838e-01, 5.599282076118623774e-02], 
-[2.257019719633921451e+00, 3.405711573811430193e-01, 6.086954730092905552e-02], 
-[2.257019719633921451e+00, 3.912898015080607528e-01, 6.758417510505836112e-02], 
-[2.257019719633921451e+00, 4.495615833752782953e-01, 7.715555736139936838e-02], 
-[2.257019719633921451e+00, 5.165113337172515529e-01, 9.145897303202110695e-02], 
-[2.257019719633921451e+00, 5.934313956619206021e-01, 1.143451365462943570e-01], 
-[2.257019719633921451e+00, 6.818065710636164178e-01, 1.551411083524362466e-01], 
-[2.257019719633921451e+00, 7.833427819015473803e-01, 2.437867800257502437e-01], 
-[2.257019719633921451e+00, 9.000000000000000222e-01, 5.611069762295448626e-01], 
-[2.257019719633921451e+00, 9.020408163265306589e-01, 5.731494136141600526e-01], 
-[2.257019719633921451e+00, 9.040816326530612956e-01, 5.856879380666742962e-01], 
-[2.257019719633921451e+00, 9.061224489795918213e-01, 5.987541072996165337e-01], 
-[2.257019719633921451e+00, 9.081632653061224580e-01, 6.123822323761332065e-01], 
-[2.257019719633921451e+00, 9.102040816326530948e-01, 6.266096859393048835e-01], 
-[2.257019719633921451e+00, 9.122448979591837315e-01, 6.414772529125927214e-01], 
-[2.257019719633921451e+00, 9.142857142857142572e-01, 6.570295306733546781e-01], 
-[2.257019719633921451e+00, 9.163265306122448939e-01, 6.733153870544081876e-01], 
-[2.257019719633921451e+00, 9.183673469387755306e-01, 6.903884861837641385e-01], 
-[2.257019719633921451e+00, 9.204081632653061673e-01, 7.083078942060900829e-01], 
-[2.257019719633921451e+00, 9.224489795918368040e-01, 7.271387794406312111e-01], 
-[2.257019719633921451e+00, 9.244897959183673297e-01, 7.469532246468602033e-01], 
-[2.257019719633921451e+00, 9.265306122448979664e-01, 7.678311729580856726e-01], 
-[2.257019719633921451e+00, 9.285714285714286031e-01, 7.898615339234873467e-01], 
-[2.257019719633921451e+00, 9.306122448979592399e-01, 8.131434822598335721e-01], 
-[2.257019719633921451e+00, 9.326530612244897656e-01, 8.377879897403330833e-01], 
-[2.257019719633921451e+00, 9.346938775510204023e-01, 8.639196406561164832e-01], 
-[2.257019719633921451e+00, 9.367346938775510390e-01, 8.916787941737004397e-01], 
-[2.257019719633921451e+00, 9.387755102040816757e-01, 9.212241736317533514e-01], 
-[2.257019719633921451e+00, 9.408163265306123124e-01, 9.527359846832916812e-01], 
-[2.257019719633921451e+00, 9.428571428571428381e-01, 9.864196930164754740e-01], 
-[2.257019719633921451e+00, 9.448979591836734748e-01, 1.022510630737570425e+00], 
-[2.257019719633921451e+00, 9.469387755102041115e-01, 1.061279652004615937e+00], 
-[2.257019719633921451e+00, 9.489795918367347483e-01, 1.103040128379747742e+00], 
-[2.257019719633921451e+00, 9.510204081632652739e-01, 1.148156670212844510e+00], 
-[2.257019719633921451e+00, 9.530612244897959107e-01, 1.197056093374723407e+00], 
-[2.257019719633921451e+00, 9.551020408163265474e-01, 1.250241337572546296e+00], 
-[2.257019719633921451e+00, 9.571428571428571841e-01, 1.308309308756292255e+00], 
-[2.257019719633921451e+00, 9.591836734693878208e-01, 1.371974003103017647e+00], 
-[2.257019719633921451e+00, 9.612244897959183465e-01, 1.442096835679801181e+00], 
-[2.257019719633921451e+00, 9.632653061224489832e-01, 1.519726942611929310e+00], 
-[2.257019719633921451e+00, 9.653061224489796199e-01, 1.606155514735104761e+00], 
-[2.257019719633921451e+00, 9.673469387755102566e-01, 1.702990227955358149e+00], 
-[2.257019719633921451e+00, 9.693877551020407823e-01, 1.812259035261562401e+00], 
-[2.257019719633921451e+00, 9.714285714285714191e-01, 1.936557821474421459e+00], 
-[2.257019719633921451e+00, 9.734693877551020558e-01, 2.079265246192612437e+00], 
-[2.257019719633921451e+00, 9.755102040816326925e-01, 2.244863474711114470e+00], 
-[2.257019719633921451e+00, 9.775510204081632182e-01, 2.439431317441605351e+00], 
-[2.257019719633921451e+00, 9.795918367346938549e-01, 2.671428887723235057e+00], 
-[2.257019719633921451e+00, 9.816326530612244916e-01, 2.952997483628852393e+00], 
-[2.257019719633921451e+00, 9.836734693877551283e-01, 3.302219317555811884e+00], 
-[2.257019719633921451e+00, 9.857142857142857650e-01, 3.747283288990361783e+00], 
-[2.257019719633921451e+00, 9.877551020408162907e-01, 4.334747510616455912e+00], 
-[2.257019719633921451e+00, 9.897959183673469274e-01, 5.147544098744072372e+00], 
-[2.257019719633921451e+00, 9.918367346938775642e-01, 6.349487301078366563e+00], 
-[2.257019719633921451e+00, 9.938775510204082009e-01, 8.316965192069568857e+00], 
-[2.257019719633921451e+00, 9.959183673469387266e-01, 1.215618325231321073e+01], 
-[2.257019719633921451e+00, 9.979591836734693633e-01, 2.322182103901351269e+01], 
-[2.257019719633921451e+00, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[2.477076355991711498e+00, 1.000000000000000021e-03, 3.945819092268383621e-02], 
-[2.477076355991711498e+00, 1.148922311909569708e-03, 3.941652561440118357e-02], 
-[2.477076355991711498e+00, 1.320022478803632065e-03, 3.937566368521598636e-02], 
-[2.477076355991711498e+00, 1.516603278119670137e-03, 3.933572502542295735e-02], 
-[2.477076355991711498e+00, 1.742459344546885402e-03, 3.929684763521175406e-02], 
-[2.477076355991711498e+00, 2.001950418545241171e-03, 3.925919042952034921e-02], 
-[2.477076355991711498e+00, 2.300085503203331758e-03, 3.922293649899752377e-02], 
-[2.477076355991711498e+00, 2.642619553930058204e-03, 3.918829690801169802e-02], 
-[2.477076355991711498e+00, 3.036164567398761706e-03, 3.915551512687841240e-02], 
-[2.477076355991711498e+00, 3.488317214113704091e-03, 3.912487221588453745e-02], 
-[2.477076355991711498e+00, 4.007805478313466660e-03, 3.909669290340516551e-02], 
-[2.477076355991711498e+00, 4.604657135827751671e-03, 3.907135273226645944e-02], 
-[2.477076355991711498e+00, 5.290393322046124149e-03, 3.904928648768662969e-02], 
-[2.477076355991711498e+00, 6.078250926476181683e-03, 3.903099817026329382e-02], 
-[2.477076355991711498e+00, 6.983438106813499684e-03, 3.901707284112346241e-02], 
-[2.477076355991711498e+00, 8.023427854757562983e-03, 3.900819074789064339e-02], 
-[2.477076355991711498e+00, 9.218295280327699903e-03, 3.900514424543249231e-02], 
-[2.477076355991711498e+00, 1.059110512533918171e-02, 3.900885816157027841e-02], 
-[2.477076355991711498e+00, 1.216835698628199354e-02, 3.902041443641288826e-02], 
-[2.477076355991711498e+00, 1.398049684082008047e-02, 3.904108209802985285e-02], 
-[2.477076355991711498e+00, 1.606250475199945058e-02, 3.907235394728561517e-02], 
-[2.477076355991711498e+00, 1.845457009472566828e-02, 3.911599173788311845e-02], 
-[2.477076355991711498e+00, 2.120286733852943389e-02, 3.917408219258827762e-02], 
-[2.477076355991711498e+00, 2.436044736169515681e-02, 3.924910694766069880e-02], 
-[2.477076355991711498e+00, 2.798826150195019707e-02, 3.934403054255610627e-02], 
-[2.477076355991711498e+00, 3.215633811115024138e-02, 3.946241198355284613e-02], 
-[2.477076355991711498e+00, 3.694513432520856594e-02, 3.960854737277517967e-02], 
-[2.477076355991711498e+00, 4.244708914272822542e-02, 3.978765385232664598e-02], 
-[2.477076355991711498e+00, 4.876840779169493850e-02, 4.000610903395172835e-02], 
-[2.477076355991711498e+00, 5.603111182818285713e-02, 4.027176572860850789e-02], 
-[2.477076355991711498e+00, 6.437539454049952259e-02, 4.059437002826396523e-02], 
-[2.477076355991711498e+00, 7.396232712556144451e-02, 4.098612300209443504e-02], 
-[2.477076355991711498e+00, 8.497696787531199003e-02, 4.146244467579003612e-02], 
-[2.477076355991711498e+00, 9.763193439036874088e-02, 4.204302723888463794e-02], 
-[2.477076355991711498e+00, 1.121715077759858903e-01, 4.275330878595073186e-02], 
-[2.477076355991711498e+00, 1.288763480443681220e-01, 4.362657014936582173e-02], 
-[2.477076355991711498e+00, 1.480689117455977755e-01, 4.470697489171943095e-02], 
-[2.477076355991711498e+00, 1.701196764046864207e-01, 4.605407220563950688e-02], 
-[2.477076355991711498e+00, 1.954542919161802172e-01, 4.774963350513126981e-02], 
-[2.477076355991711498e+00, 2.245617969409859638e-01, 4.990833512899245372e-02], 
-[2.477076355991711498e+00, 2.580040589080049296e-01, 5.269502646129903267e-02], 
-[2.477076355991711498e+00, 2.964266198426381838e-01, 5.635379584170979728e-02], 
-[2.477076355991711498e+00, 3.405711573811430193e-01, 6.125935403353406639e-02], 
-[2.477076355991711498e+00, 3.912898015080607528e-01, 6.801354134439965837e-02], 
-[2.477076355991711498e+00, 4.495615833752782953e-01, 7.764099982282228474e-02], 
-[2.477076355991711498e+00, 5.165113337172515529e-01, 9.202753362714743979e-02], 
-[2.477076355991711498e+00, 5.934313956619206021e-01, 1.150451483256447749e-01], 
-[2.477076355991711498e+00, 6.818065710636164178e-01, 1.560714952875574546e-01], 
-[2.477076355991711498e+00, 7.833427819015473803e-01, 2.452045728741012731e-01], 
-[2.477076355991711498e+00, 9.000000000000000222e-01, 5.641801534900329207e-01], 
-[2.477076355991711498e+00, 9.020408163265306589e-01, 5.762834967883730952e-01], 
-[2.477076355991711498e+00, 9.040816326530612956e-01, 5.888853181741593446e-01], 
-[2.477076355991711498e+00, 9.061224489795918213e-01, 6.020173224859406425e-01], 
-[2.477076355991711498e+00, 9.081632653061224580e-01, 6.157139804259346150e-01], 
-[2.477076355991711498e+00, 9.102040816326530948e-01, 6.300128381611018735e-01], 
-[2.477076355991711498e+00, 9.122448979591837315e-01, 6.449548695810064514e-01], 
-[2.477076355991711498e+00, 9.142857142857142572e-01, 6.605848782445398193e-01], 
-[2.477076355991711498e+00, 9.163265306122448939e-01, 6.769519574063473932e-01], 
-[2.477076355991711498e+00, 9.183673469387755306e-01, 6.941100181759691790e-01], 
-[2.477076355991711498e+00, 9.204081632653061673e-01, 7.121183979047069901e-01], 
-[2.477076355991711498e+00, 9.224489795918368040e-01, 7.310425634169981368e-01], 
-[2.477076355991711498e+00, 9.244897959183673297e-01, 7.509549268326934923e-01], 
-[2.477076355991711498e+00, 9.265306122448979664e-01, 7.719357956319174985e-01], 
-[2.477076355991711498e+00, 9.285714285714286031e-01, 7.940744835148016989e-01], 
-[2.477076355991711498e+00, 9.306122448979592399e-01, 8.174706147948722634e-01], 
-[2.477076355991711498e+00, 9.326530612244897656e-01, 8.422356629235804304e-01], 
-[2.477076355991711498e+00, 9.346938775510204023e-01, 8.684947737930044376e-01], 
-[2.477076355991711498e+00, 9.367346938775510390e-01, 8.963889374048487069e-01], 
-[2.477076355991711498e+00, 9.387755102040816757e-01, 9.260775882827232408e-01], 
-[2.477076355991711498e+00, 9.408163265306123124e-01, 9.577417369572489569e-01], 
-[2.477076355991711498e+00, 9.428571428571428381e-01, 9.915877637985778259e-01], 
-[2.477076355991711498e+00, 9.448979591836734748e-01, 1.027852044977708434e+00], 
-[2.477076355991711498e+00, 9.469387755102041115e-01, 1.066806632052282877e+00], 
-[2.477076355991711498e+00, 9.489795918367347483e-01, 1.108766276834907583e+00], 
-[2.477076355991711498e+00, 9.510204081632652739e-01, 1.154097189433355153e+00], 
-[2.477076355991711498e+00, 9.530612244897959107e-01, 1.203228050891895329e+00], 
-[2.477076355991711498e+00, 9.551020408163265474e-01, 1.256663989525248493e+00], 
-[2.477076355991711498e+00, 9.571428571428571841e-01, 1.315004497373468695e+00], 
-[2.477076355991711498e+00, 9.591836734693878208e-01, 1.378966649710423820e+00], 
-[2.477076355991711498e+00, 9.612244897959183465e-01, 1.449415558384699487e+00], 
-[2.477076355991711498e+00, 9.632653061224489832e-01, 1.527404838817955079e+00], 
-[2.477076355991711498e+00, 9.653061224489796199e-01, 1.614231164672703001e+00], 
-[2.477076355991711498e+00, 9.673469387755102566e-01, 1.711508999241599271e+00], 
-[2.477076355991711498e+00, 9.693877551020407823e-01, 1.821274804683939763e+00], 
-[2.477076355991711498e+00, 9.714285714285714191e-01, 1.946135286459848235e+00], 
-[2.477076355991711498e+00, 9.734693877551020558e-01, 2.089483088310951864e+00], 
-[2.477076355991711498e+00, 9.755102040816326925e-01, 2.255818785602316190e+00], 
-[2.477076355991711498e+00, 9.775510204081632182e-01, 2.451245949999480978e+00], 
-[2.477076355991711498e+00, 9.795918367346938549e-01, 2.684258843487051571e+00], 
-[2.477076355991711498e+00, 9.816326530612244916e-01, 2.967047281005307013e+00], 
-[2.477076355991711498e+00, 9.836734693877551283e-01, 3.317764925119188746e+00], 
-[2.477076355991711498e+00, 9.857142857142857650e-01, 3.764710656536923050e+00], 
-[2.477076355991711498e+00, 9.877551020408162907e-01, 4.354621608663807208e+00], 
-[2.477076355991711498e+00, 9.897959183673469274e-01, 5.170743366613300473e+00], 
-[2.477076355991711498e+00, 9.918367346938775642e-01, 6.377496663017609535e+00], 
-[2.477076355991711498e+00, 9.938775510204082009e-01, 8.352626907898709874e+00], 
-[2.477076355991711498e+00, 9.959183673469387266e-01, 1.220618724348973139e+01], 
-[2.477076355991711498e+00, 9.979591836734693633e-01, 2.331040308113694337e+01], 
-[2.477076355991711498e+00, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[2.718588242732943083e+00, 1.000000000000000021e-03, 3.973044991395866671e-02], 
-[2.718588242732943083e+00, 1.148922311909569708e-03, 3.968820627414598734e-02], 
-[2.718588242732943083e+00, 1.320022478803632065e-03, 3.964677106177715016e-02], 
-[2.718588242732943083e+00, 1.516603278119670137e-03, 3.960626491459233456e-02], 
-[2.718588242732943083e+00, 1.742459344546885402e-03, 3.956682669226657678e-02], 
-[2.718588242732943083e+00, 2.001950418545241171e-03, 3.952861629849000608e-02], 
-[2.718588242732943083e+00, 2.300085503203331758e-03, 3.949181796194516092e-02], 
-[2.718588242732943083e+00, 2.642619553930058204e-03, 3.945664405760708482e-02], 
-[2.718588242732943083e+00, 3.036164567398761706e-03, 3.942333956613321144e-02], 
-[2.718588242732943083e+00, 3.488317214113704091e-03, 3.939218728962552707e-02], 
-[2.718588242732943083e+00, 4.007805478313466660e-03, 3.936351396694014876e-02], 
-[2.718588242732943083e+00, 4.604657135827751671e-03, 3.933769746374130710e-02], 
-[2.718588242732943083e+00, 5.290393322046124149e-03, 3.931517525193260060e-02], 
-[2.718588242732943083e+00, 6.078250926476181683e-03, 3.929645444352915240e-02], 
-[2.718588242732943083e+00, 6.983438106813499684e-03, 3.928212370806796749e-02], 
-[2.718588242732943083e+00, 8.023427854757562983e-03, 3.927286748468630795e-02], 
-[2.718588242732943083e+00, 9.218295280327699903e-03, 3.926948300593187391e-02], 
-[2.718588242732943083e+00, 1.059110512533918171e-02, 3.927290078742173146e-02], 
-[2.718588242732943083e+00, 1.216835698628199354e-02, 3.928420941700114244e-02], 
-[2.718588242732943083e+00, 1.398049684082008047e-02, 3.930468571251968801e-02], 
-[2.718588242732943083e+00, 1.606250475199945058e-02, 3.933583162929847610e-02], 
-[2.718588242732943083e+00, 1.845457009472566828e-02, 3.937941971405391900e-02], 
-[2.718588242732943083e+00, 2.120286733852943389e-02, 3.943754946026831881e-02], 
-[2.718588242732943083e+00, 2.436044736169515681e-02, 3.951271767550956771e-02], 
-[2.718588242732943083e+00, 2.798826150195019707e-02, 3.960790700230966410e-02], 
-[2.718588242732943083e+00, 3.215633811115024138e-02, 3.972669815413032435e-02], 
-[2.718588242732943083e+00, 3.694513432520856594e-02, 3.987341340231587150e-02], 
-[2.718588242732943083e+00, 4.244708914272822542e-02, 4.005330162435309649e-02], 
-[2.718588242732943083e+00, 4.876840779169493850e-02, 4.027277916738867397e-02], 
-[2.718588242732943083e+00, 5.603111182818285713e-02, 4.053974645780059061e-02], 
-[2.718588242732943083e+00, 6.437539454049952259e-02, 4.086400857337244008e-02], 
-[2.718588242732943083e+00, 7.396232712556144451e-02, 4.125784027509722673e-02], 
-[2.718588242732943083e+00, 8.497696787531199003e-02, 4.173675450816723143e-02], 
-[2.718588242732943083e+00, 9.763193439036874088e-02, 4.232056182010093121e-02], 
-[2.718588242732943083e+00, 1.121715077759858903e-01, 4.303485275816916478e-02], 
-[2.718588242732943083e+00, 1.288763480443681220e-01, 4.391310696509140299e-02], 
-[2.718588242732943083e+00, 1.480689117455977755e-01, 4.499975086689050885e-02], 
-[2.718588242732943083e+00, 1.701196764046864207e-01, 4.635468664988243170e-02], 
-[2.718588242732943083e+00, 1.954542919161802172e-01, 4.806016822408414046e-02], 
-[2.718588242732943083e+00, 2.245617969409859638e-01, 5.023154507549683345e-02], 
-[2.718588242732943083e+00, 2.580040589080049296e-01, 5.303462857474165043e-02], 
-[2.718588242732943083e+00, 2.964266198426381838e-01, 5.671492195145462489e-02], 
-[2.718588242732943083e+00, 3.405711573811430193e-01, 6.164929145198780325e-02], 
-[2.718588242732943083e+00, 3.912898015080607528e-01, 6.844300890152003880e-02], 
-[2.718588242732943083e+00, 4.495615833752782953e-01, 7.812649839379356975e-02], 
-[2.718588242732943083e+00, 5.165113337172515529e-01, 9.259607528043450886e-02], 
-[2.718588242732943083e+00, 5.934313956619206021e-01, 1.157450039427189714e-01], 
-[2.718588242732943083e+00, 6.818065710636164178e-01, 1.570014376607773710e-01], 
-[2.718588242732943083e+00, 7.833427819015473803e-01, 2.466211500423222680e-01], 
-[2.718588242732943083e+00, 9.000000000000000222e-01, 5.672484079606248120e-01], 
-[2.718588242732943083e+00, 9.020408163265306589e-01, 5.794124967971219231e-01], 
-[2.718588242732943083e+00, 9.040816326530612956e-01, 5.920774469481597801e-01], 
-[2.718588242732943083e+00, 9.061224489795918213e-01, 6.052751098349512526e-01], 
-[2.718588242732943083e+00, 9.081632653061224580e-01, 6.190401152050291067e-01], 
-[2.718588242732943083e+00, 9.102040816326530948e-01, 6.334101820991726584e-01], 
-[2.718588242732943083e+00, 9.122448979591837315e-01, 6.484264726599380246e-01], 
-[2.718588242732943083e+00, 9.142857142857142572e-01, 6.641339958438527979e-01], 
-[2.718588242732943083e+00, 9.163265306122448939e-01, 6.805820694638188284e-01], 
-[2.718588242732943083e+00, 9.183673469387755306e-01, 6.978248506574011856e-01], 
-[2.718588242732943083e+00, 9.204081632653061673e-01, 7.159219469272335434e-01], 
-[2.718588242732943083e+00, 9.224489795918368040e-01, 7.349391224320550586e-01], 
-[2.718588242732943083e+00, 9.244897959183673297e-01, 7.549491173495541663e-01], 
-[2.718588242732943083e+00, 9.265306122448979664e-01, 7.760326020536663094e-01], 
-[2.718588242732943083e+00, 9.285714285714286031e-01, 7.982792927699110530e-01], 
-[2.718588242732943083e+00, 9.306122448979592399e-01, 8.217892615843607196e-01], 
-[2.718588242732943083e+00, 9.326530612244897656e-01, 8.466744815729232432e-01], 
-[2.718588242732943083e+00, 9.346938775510204023e-01, 8.730606579084143615e-01], 
-[2.718588242732943083e+00, 9.367346938775510390e-01, 9.010894087969658628e-01], 
-[2.718588242732943083e+00, 9.387755102040816757e-01, 9.309208769526742255e-01], 
-[2.718588242732943083e+00, 9.408163265306123124e-01, 9.627368743612666480e-01], 
-[2.718588242732943083e+00, 9.428571428571428381e-01, 9.967446921459233167e-01], 
-[2.718588242732943083e+00, 9.448979591836734748e-01, 1.033181746010748636e+00], 
-[2.718588242732943083e+00, 9.469387755102041115e-01, 1.072321279659870452e+00], 
-[2.718588242732943083e+00, 9.489795918367347483e-01, 1.114479419033863383e+00], 
-[2.718588242732943083e+00, 9.510204081632652739e-01, 1.160023966820916241e+00], 
-[2.718588242732943083e+00, 9.530612244897959107e-01, 1.209385460771410070e+00], 
-[2.718588242732943083e+00, 9.551020408163265474e-01, 1.263071207750249503e+00], 
-[2.718588242732943083e+00, 9.571428571428571841e-01, 1.321683273852677143e+00], 
-[2.718588242732943083e+00, 9.591836734693878208e-01, 1.385941798931142888e+00], 
-[2.718588242732943083e+00, 9.612244897959183465e-01, 1.456715573945770004e+00], 
-[2.718588242732943083e+00, 9.632653061224489832e-01, 1.535062671897782671e+00], 
-[2.718588242732943083e+00, 9.653061224489796199e-01, 1.622285222296415697e+00], 
-[2.718588242732943083e+00, 9.673469387755102566e-01, 1.720004441897269754e+00], 
-[2.718588242732943083e+00, 9.693877551020407823e-01, 1.830265258799149919e+00], 
-[2.718588242732943083e+00, 9.714285714285714191e-01, 1.955685143170336815e+00], 
-[2.718588242732943083e+00, 9.734693877551020558e-01, 2.099670649279493428e+00], 
-[2.718588242732943083e+00, 9.755102040816326925e-01, 2.266740663745621998e+00], 
-[2.718588242732943083e+00, 9.775510204081632182e-01, 2.463023383793582433e+00], 
-[2.718588242732943083e+00, 9.795918367346938549e-01, 2.697047028689697257e+00], 
-[2.718588242732943083e+00, 9.816326530612244916e-01, 2.981049651705639292e+00], 
-[2.718588242732943083e+00, 9.836734693877551283e-01, 3.333255944393525461e+00], 
-[2.718588242732943083e+00, 9.857142857142857650e-01, 3.782074101166255531e+00], 
-[2.718588242732943083e+00, 9.877551020408162907e-01, 4.374419153475312960e+00], 
-[2.718588242732943083e+00, 9.897959183673469274e-01, 5.193848114597108712e+00], 
-[2.718588242732943083e+00, 9.918367346938775642e-01, 6.405384077203708060e+00], 
-[2.718588242732943083e+00, 9.938775510204082009e-01, 8.388120048090257797e+00], 
-[2.718588242732943083e+00, 9.959183673469387266e-01, 1.225592721870141588e+01], 
-[2.718588242732943083e+00, 9.979591836734693633e-01, 2.339842634050194192e+01], 
-[2.718588242732943083e+00, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[2.983647240283340274e+00, 1.000000000000000021e-03, 4.000307325568880357e-02], 
-[2.983647240283340274e+00, 1.148922311909569708e-03, 3.996024696861398551e-02], 
-[2.983647240283340274e+00, 1.320022478803632065e-03, 3.991823415793353813e-02], 
-[2.983647240283340274e+00, 1.516603278119670137e-03, 3.987715620885364659e-02], 
-[2.983647240283340274e+00, 1.742459344546885402e-03, 3.983715284054796524e-02], 
-[2.983647240283340274e+00, 2.001950418545241171e-03, 3.979838494546250605e-02], 
-[2.983647240283340274e+00, 2.300085503203331758e-03, 3.976103789030434321e-02], 
-[2.983647240283340274e+00, 2.642619553930058204e-03, 3.972532536062930997e-02], 
-[2.983647240283340274e+00, 3.036164567398761706e-03, 3.969149384738927810e-02], 
-[2.983647240283340274e+00, 3.488317214113704091e-03, 3.965982789442654144e-02], 
-[2.983647240283340274e+00, 4.007805478313466660e-03, 3.963065625096880151e-02], 
-[2.983647240283340274e+00, 4.604657135827751671e-03, 3.960435910536538873e-02], 
-[2.983647240283340274e+00, 5.290393322046124149e-03, 3.958137661599775425e-02], 
-[2.983647240283340274e+00, 6.078250926476181683e-03, 3.956221900602305275e-02], 
-[2.983647240283340274e+00, 6.983438106813499684e-03, 3.954747855302839094e-02], 
-[2.983647240283340274e+00, 8.023427854757562983e-03, 3.953784388719962933e-02], 
-[2.983647240283340274e+00, 9.218295280327699903e-03, 3.953411711816881557e-02], 
-[2.983647240283340274e+00, 1.059110512533918171e-02, 3.953723444859051639e-02], 
-[2.983647240283340274e+00, 1.216835698628199354e-02, 3.954829111308527656e-02], 
-[2.983647240283340274e+00, 1.398049684082008047e-02, 3.956857171806804629e-02], 
-[2.983647240283340274e+00, 1.606250475199945058e-02, 3.959958737178362331e-02], 
-[2.983647240283340274e+00, 1.845457009472566828e-02, 3.964312141202699230e-02], 
-[2.983647240283340274e+00, 2.120286733852943389e-02, 3.970128610055187468e-02], 
-[2.983647240283340274e+00, 2.436044736169515681e-02, 3.977659341313742603e-02], 
-[2.983647240283340274e+00, 2.798826150195019707e-02, 3.987204409145474193e-02], 
-[2.983647240283340274e+00, 3.215633811115024138e-02, 3.999124055111995257e-02], 
-[2.983647240283340274e+00, 3.694513432520856594e-02, 4.013853122623609049e-02], 
-[2.983647240283340274e+00, 4.244708914272822542e-02, 4.031919672131334398e-02], 
-[2.983647240283340274e+00, 4.876840779169493850e-02, 4.053969210799708567e-02], 
-[2.983647240283340274e+00, 5.603111182818285713e-02, 4.080796541373407638e-02], 
-[2.983647240283340274e+00, 6.437539454049952259e-02, 4.113388068304418832e-02], 
-[2.983647240283340274e+00, 7.396232712556144451e-02, 4.152978634308684969e-02], 
-[2.983647240283340274e+00, 8.497696787531199003e-02, 4.201128822365703119e-02], 
-[2.983647240283340274e+00, 9.763193439036874088e-02, 4.259831518215181911e-02], 
-[2.983647240283340274e+00, 1.121715077759858903e-01, 4.331661015129192188e-02], 
-[2.983647240283340274e+00, 1.288763480443681220e-01, 4.419985148868767200e-02], 
-[2.983647240283340274e+00, 1.480689117455977755e-01, 4.529272834604447517e-02], 
-[2.983647240283340274e+00, 1.701196764046864207e-01, 4.665549570089613796e-02], 
-[2.983647240283340274e+00, 1.954542919161802172e-01, 4.837088965551930575e-02], 
-[2.983647240283340274e+00, 2.245617969409859638e-01, 5.055493237668969714e-02], 
-[2.983647240283340274e+00, 2.580040589080049296e-01, 5.337439648576017270e-02], 
-[2.983647240283340274e+00, 2.964266198426381838e-01, 5.707619890387578138e-02], 
-[2.983647240283340274e+00, 3.405711573811430193e-01, 6.203935933126595442e-02], 
-[2.983647240283340274e+00, 3.912898015080607528e-01, 6.887257750503371356e-02], 
-[2.983647240283340274e+00, 4.495615833752782953e-01, 7.861205274698751522e-02], 
-[2.983647240283340274e+00, 5.165113337172515529e-01, 9.316459759856191014e-02], 
-[2.983647240283340274e+00, 5.934313956619206021e-01, 1.164447029344615747e-01], 
-[2.983647240283340274e+00, 6.818065710636164178e-01, 1.579309349760228409e-01], 
-[2.983647240283340274e+00, 7.833427819015473803e-01, 2.480365112958015372e-01], 
-[2.983647240283340274e+00, 9.000000000000000222e-01, 5.703117431193478470e-01], 
-[2.983647240283340274e+00, 9.020408163265306589e-01, 5.825364173284870439e-01], 
-[2.983647240283340274e+00, 9.040816326530612956e-01, 5.952643283001206598e-01], 
-[2.983647240283340274e+00, 9.061224489795918213e-01, 6.085274734958467935e-01], 
-[2.983647240283340274e+00, 9.081632653061224580e-01, 6.223606411159459117e-01], 
-[2.983647240283340274e+00, 9.102040816326530948e-01, 6.368017224262694231e-01], 
-[2.983647240283340274e+00, 9.122448979591837315e-01, 6.518920671107071296e-01], 
-[2.983647240283340274e+00, 9.142857142857142572e-01, 6.676768887411399511e-01], 
-[2.983647240283340274e+00, 9.163265306122448939e-01, 6.842057288269476345e-01], 
-[2.983647240283340274e+00, 9.183673469387755306e-01, 7.015329895822133288e-01], 
-[2.983647240283340274e+00, 9.204081632653061673e-01, 7.197185476078425959e-01], 
-[2.983647240283340274e+00, 9.224489795918368040e-01, 7.388284632284840558e-01], 
-[2.983647240283340274e+00, 9.244897959183673297e-01, 7.589358033799356029e-01], 
-[2.983647240283340274e+00, 9.265306122448979664e-01, 7.801215998801114271e-01], 
-[2.983647240283340274e+00, 9.285714285714286031e-01, 8.024759698579364553e-01], 
-[2.983647240283340274e+00, 9.306122448979592399e-01, 8.260994313518792431e-01], 
-[2.983647240283340274e+00, 9.326530612244897656e-01, 8.511044550131421360e-01], 
-[2.983647240283340274e+00, 9.346938775510204023e-01, 8.776173029803482351e-01], 
-[2.983647240283340274e+00, 9.367346938775510390e-01, 9.057802190393420272e-01], 
-[2.983647240283340274e+00, 9.387755102040816757e-01, 9.357540511072190981e-01], 
-[2.983647240283340274e+00, 9.408163265306123124e-01, 9.677214092103673115e-01], 
-[2.983647240283340274e+00, 9.428571428571428381e-01, 1.001890491305377440e+00], 
-[2.983647240283340274e+00, 9.448979591836734748e-01, 1.038499748108747678e+00], 
-[2.983647240283340274e+00, 9.469387755102041115e-01, 1.077823610230780993e+00], 
-[2.983647240283340274e+00, 9.489795918367347483e-01, 1.120179571632620608e+00], 
-[2.983647240283340274e+00, 9.510204081632652739e-01, 1.165937020423343906e+00], 
-[2.983647240283340274e+00, 9.530612244897959107e-01, 1.215528342613537038e+00], 
-[2.983647240283340274e+00, 9.551020408163265474e-01, 1.269463013586731526e+00], 
-[2.983647240283340274e+00, 9.571428571428571841e-01, 1.328345661489783947e+00], 
-[2.983647240283340274e+00, 9.591836734693878208e-01, 1.392899476273816939e+00], 
-[2.983647240283340274e+00, 9.612244897959183465e-01, 1.463996910387846517e+00], 
-[2.983647240283340274e+00, 9.632653061224489832e-01, 1.542700472754909624e+00], 
-[2.983647240283340274e+00, 9.653061224489796199e-01, 1.630317721825404131e+00], 
-[2.983647240283340274e+00, 9.673469387755102566e-01, 1.728476593989438648e+00], 
-[2.983647240283340274e+00, 9.693877551020407823e-01, 1.839230440177885839e+00], 
-[2.983647240283340274e+00, 9.714285714285714191e-01, 1.965207439498509956e+00], 
-[2.983647240283340274e+00, 9.734693877551020558e-01, 2.109827983349133795e+00], 
-[2.983647240283340274e+00, 9.755102040816326925e-01, 2.277629171085011617e+00], 
-[2.983647240283340274e+00, 9.775510204081632182e-01, 2.474763690214206946e+00], 
-[2.983647240283340274e+00, 9.795918367346938549e-01, 2.709793526524259200e+00], 
-[2.983647240283340274e+00, 9.816326530612244916e-01, 2.995004693981178079e+00], 
-[2.983647240283340274e+00, 9.836734693877551283e-01, 3.348692493338138121e+00], 
-[2.983647240283340274e+00, 9.857142857142857650e-01, 3.799373767467266738e+00], 
-[2.983647240283340274e+00, 9.877551020408162907e-01, 4.394140327130307888e+00], 
-[2.983647240283340274e+00, 9.897959183673469274e-01, 5.216858580535600254e+00], 
-[2.983647240283340274e+00, 9.918367346938775642e-01, 6.433149871085515947e+00], 
-[2.983647240283340274e+00, 9.938775510204082009e-01, 8.423445102091747572e+00], 
-[2.983647240283340274e+00, 9.959183673469387266e-01, 1.230540402617043050e+01], 
-[2.983647240283340274e+00, 9.979591836734693633e-01, 2.348589291146090119e+01], 
-[2.983647240283340274e+00, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[3.274549162877731678e+00, 1.000000000000000021e-03, 4.027606119594128592e-02], 
-[3.274549162877731678e+00, 1.148922311909569708e-03, 4.023264793883948864e-02], 
-[3.274549162877731678e+00, 1.320022478803632065e-03, 4.019005320767818357e-02], 
-[3.274549162877731678e+00, 1.516603278119670137e-03, 4.014839913514892111e-02], 
-[3.274549162877731678e+00, 1.742459344546885402e-03, 4.010782629993585313e-02], 
-[3.274549162877731678e+00, 2.001950418545241171e-03, 4.006849658324288660e-02], 
-[3.274549162877731678e+00, 2.300085503203331758e-03, 4.003059648979068186e-02], 
-[3.274549162877731678e+00, 2.642619553930058204e-03, 3.999434101568793976e-02], 
-[3.274549162877731678e+00, 3.036164567398761706e-03, 3.995997816213107956e-02], 
-[3.274549162877731678e+00, 3.488317214113704091e-03, 3.992779421462526457e-02], 
-[3.274549162877731678e+00, 4.007805478313466660e-03, 3.989811993265714174e-02], 
-[3.274549162877731678e+00, 4.604657135827751671e-03, 3.987133782710451657e-02], 
-[3.274549162877731678e+00, 5.290393322046124149e-03, 3.984789074261503583e-02], 
-[3.274549162877731678e+00, 6.078250926476181683e-03, 3.982829201320772783e-02], 
-[3.274549162877731678e+00, 6.983438106813499684e-03, 3.981313752415429480e-02], 
-[3.274549162877731678e+00, 8.023427854757562983e-03, 3.980312009621772562e-02], 
-[3.274549162877731678e+00, 9.218295280327699903e-03, 3.979904671551137696e-02], 
-[3.274549162877731678e+00, 1.059110512533918171e-02, 3.980185927096046433e-02], 
-[3.274549162877731678e+00, 1.216835698628199354e-02, 3.981265964298982829e-02], 
-[3.274549162877731678e+00, 1.398049684082008047e-02, 3.983274022535370634e-02], 
-[3.274549162877731678e+00, 1.606250475199945058e-02, 3.986362127767406616e-02], 
-[3.274549162877731678e+00, 1.845457009472566828e-02, 3.990709692687394172e-02], 
-[3.274549162877731678e+00, 2.120286733852943389e-02, 3.996529220051506931e-02], 
-[3.274549162877731678e+00, 2.436044736169515681e-02, 4.004073423946909183e-02], 
-[3.274549162877731678e+00, 2.798826150195019707e-02, 4.013644188058479445e-02], 
-[3.274549162877731678e+00, 3.215633811115024138e-02, 4.025603923656916050e-02], 
-[3.274549162877731678e+00, 3.694513432520856594e-02, 4.040390089779048732e-02], 
-[3.274549162877731678e+00, 4.244708914272822542e-02, 4.058533918737770863e-02], 
-[3.274549162877731678e+00, 4.876840779169493850e-02, 4.080684789051897826e-02], 
-[3.274549162877731678e+00, 5.603111182818285713e-02, 4.107642262131545874e-02], 
-[3.274549162877731678e+00, 6.437539454049952259e-02, 4.140398637186593067e-02], 
-[3.274549162877731678e+00, 7.396232712556144451e-02, 4.180196120975170071e-02], 
-[3.274549162877731678e+00, 8.497696787531199003e-02, 4.228604581435443932e-02], 
-[3.274549162877731678e+00, 9.763193439036874088e-02, 4.287628730469943139e-02], 
-[3.274549162877731678e+00, 1.121715077759858903e-01, 4.359858093152796377e-02], 
-[3.274549162877731678e+00, 1.288763480443681220e-01, 4.448680367166237687e-02], 
-[3.274549162877731678e+00, 1.480689117455977755e-01, 4.558590726445044955e-02], 
-[3.274549162877731678e+00, 1.701196764046864207e-01, 4.695649927580314298e-02], 
-[3.274549162877731678e+00, 1.954542919161802172e-01, 4.868179769602680451e-02], 
-[3.274549162877731678e+00, 2.245617969409859638e-01, 5.087849690562348814e-02], 
-[3.274549162877731678e+00, 2.580040589080049296e-01, 5.371433004005143896e-02], 
-[3.274549162877731678e+00, 2.964266198426381838e-01, 5.743762651244734008e-02], 
-[3.274549162877731678e+00, 3.405711573811430193e-01, 6.242955744640198146e-02], 
-[3.274549162877731678e+00, 3.912898015080607528e-01, 6.930224688367156438e-02], 
-[3.274549162877731678e+00, 4.495615833752782953e-01, 7.909766255528666301e-02], 
-[3.274549162877731678e+00, 5.165113337172515529e-01, 9.373310018856544079e-02], 
-[3.274549162877731678e+00, 5.934313956619206021e-01, 1.171442448384246993e-01], 
-[3.274549162877731678e+00, 6.818065710636164178e-01, 1.588599867382849695e-01], 
-[3.274549162877731678e+00, 7.833427819015473803e-01, 2.494506564018760253e-01], 
-[3.274549162877731678e+00, 9.000000000000000222e-01, 5.733701624465459279e-01], 
-[3.274549162877731678e+00, 9.020408163265306589e-01, 5.856552620727772940e-01], 
-[3.274549162877731678e+00, 9.040816326530612956e-01, 5.984459661436152267e-01], 
-[3.274549162877731678e+00, 9.061224489795918213e-01, 6.117744176198416373e-01], 
-[3.274549162877731678e+00, 9.081632653061224580e-01, 6.256755625631039708e-01], 
-[3.274549162877731678e+00, 9.102040816326530948e-01, 6.401874638168902898e-01], 
-[3.274549162877731678e+00, 9.122448979591837315e-01, 6.553516578962186312e-01], 
-[3.274549162877731678e+00, 9.142857142857142572e-01, 6.712135622076516039e-01], 
-[3.274549162877731678e+00, 9.163265306122448939e-01, 6.878229410970593261e-01], 
-[3.274549162877731678e+00, 9.183673469387755306e-01, 7.052344409055397723e-01], 
-[3.274549162877731678e+00, 9.204081632653061673e-01, 7.235082062814237602e-01], 
-[3.274549162877731678e+00, 9.224489795918368040e-01, 7.427105925493941996e-01], 
-[3.274549162877731678e+00, 9.244897959183673297e-01, 7.629149921064360962e-01], 
-[3.274549162877731678e+00, 9.265306122448979664e-01, 7.842027967677738243e-01], 
-[3.274549162877731678e+00, 9.285714285714286031e-01, 8.066645229473319301e-01], 
-[3.274549162877731678e+00, 9.306122448979592399e-01, 8.304011328198843689e-01], 
-[3.274549162877731678e+00, 9.326530612244897656e-01, 8.555255925673788120e-01], 
-[3.274549162877731678e+00, 9.346938775510204023e-01, 8.821647189845847059e-01], 
-[3.274549162877731678e+00, 9.367346938775510390e-01, 9.104613788183905099e-01], 
-[3.274549162877731678e+00, 9.387755102040816757e-01, 9.405771222083536554e-01], 
-[3.274549162877731678e+00, 9.408163265306123124e-01, 9.726953538151138501e-01], 
-[3.274549162877731678e+00, 9.428571428571428381e-01, 1.007025174518393573e+00], 
-[3.274549162877731678e+00, 9.448979591836734748e-01, 1.043806065537265182e+00], 
-[3.274549162877731678e+00, 9.469387755102041115e-01, 1.083313639160677688e+00], 
-[3.274549162877731678e+00, 9.489795918367347483e-01, 1.125866751278034705e+00], 
-[3.274549162877731678e+00, 9.510204081632652739e-01, 1.171836368277674900e+00], 
-[3.274549162877731678e+00, 9.530612244897959107e-01, 1.221656716005893983e+00], 
-[3.274549162877731678e+00, 9.551020408163265474e-01, 1.275839428359051730e+00], 
-[3.274549162877731678e+00, 9.571428571428571841e-01, 1.334991683563309106e+00], 
-[3.274549162877731678e+00, 9.591836734693878208e-01, 1.399839707226786745e+00], 
-[3.274549162877731678e+00, 9.612244897959183465e-01, 1.471259595712012036e+00], 
-[3.274549162877731678e+00, 9.632653061224489832e-01, 1.550318272264989972e+00], 
-[3.274549162877731678e+00, 9.653061224489796199e-01, 1.638328697446113091e+00], 
-[3.274549162877731678e+00, 9.673469387755102566e-01, 1.736925493546614074e+00], 
-[3.274549162877731678e+00, 9.693877551020407823e-01, 1.848170391345195451e+00], 
-[3.274549162877731678e+00, 9.714285714285714191e-01, 1.974702223282689406e+00], 
-[3.274549162877731678e+00, 9.734693877551020558e-01, 2.119955144705752748e+00], 
-[3.274549162877731678e+00, 9.755102040816326925e-01, 2.288484369485997316e+00], 
-[3.274549162877731678e+00, 9.775510204081632182e-01, 2.486466940556043781e+00], 
-[3.274549162877731678e+00, 9.795918367346938549e-01, 2.722498420065953884e+00], 
-[3.274549162877731678e+00, 9.816326530612244916e-01, 3.008912505935780857e+00], 
-[3.274549162877731678e+00, 9.836734693877551283e-01, 3.364074689724470879e+00], 
-[3.274549162877731678e+00, 9.857142857142857650e-01, 3.816609799783816648e+00], 
-[3.274549162877731678e+00, 9.877551020408162907e-01, 4.413785311378582321e+00], 
-[3.274549162877731678e+00, 9.897959183673469274e-01, 5.239775001806673771e+00], 
-[3.274549162877731678e+00, 9.918367346938775642e-01, 6.460794371423073557e+00], 
-[3.274549162877731678e+00, 9.938775510204082009e-01, 8.458602558222036549e+00], 
-[3.274549162877731678e+00, 9.959183673469387266e-01, 1.235461851192581051e+01], 
-[3.274549162877731678e+00, 9.979591836734693633e-01, 2.357280488197023161e+01], 
-[3.274549162877731678e+00, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[3.593813663804629410e+00, 1.000000000000000021e-03, 4.054941398285348553e-02], 
-[3.593813663804629410e+00, 1.148922311909569708e-03, 4.050540942592305987e-02], 
-[3.593813663804629410e+00, 1.320022478803632065e-03, 4.046222844506631999e-02], 
-[3.593813663804629410e+00, 1.516603278119670137e-03, 4.041999392047827822e-02], 
-[3.593813663804629410e+00, 1.742459344546885402e-03, 4.037884729036406856e-02], 
-[3.593813663804629410e+00, 2.001950418545241171e-03, 4.033895142468601341e-02], 
-[3.593813663804629410e+00, 2.300085503203331758e-03, 4.030049396616554314e-02], 
-[3.593813663804629410e+00, 2.642619553930058204e-03, 4.026369122143418078e-02], 
-[3.593813663804629410e+00, 3.036164567398761706e-03, 4.022879270188070566e-02], 
-[3.593813663804629410e+00, 3.488317214113704091e-03, 4.019608643459286756e-02], 
-[3.593813663804629410e+00, 4.007805478313466660e-03, 4.016590518920057362e-02], 
-[3.593813663804629410e+00, 4.604657135827751671e-03, 4.013863379894980904e-02], 
-[3.593813663804629410e+00, 5.290393322046124149e-03, 4.011471779453869291e-02], 
-[3.593813663804629410e+00, 6.078250926476181683e-03, 4.009467362056310519e-02], 
-[3.593813663804629410e+00, 6.983438106813499684e-03, 4.007910076960836954e-02], 
-[3.593813663804629410e+00, 8.023427854757562983e-03, 4.006869625253679096e-02], 
-[3.593813663804629410e+00, 9.218295280327699903e-03, 4.006427193133264841e-02], 
-[3.593813663804629410e+00, 1.059110512533918171e-02, 4.006677538041639175e-02], 
-[3.593813663804629410e+00, 1.216835698628199354e-02, 4.007731512503641402e-02], 
-[3.593813663804629410e+00, 1.398049684082008047e-02, 4.009719134504852178e-02], 
-[3.593813663804629410e+00, 1.606250475199945058e-02, 4.012793344989197541e-02], 
-[3.593813663804629410e+00, 1.845457009472566828e-02, 4.017134635365163242e-02], 
-[3.593813663804629410e+00, 2.120286733852943389e-02, 4.022956784721538892e-02], 
-[3.593813663804629410e+00, 2.436044736169515681e-02, 4.030514023340694280e-02], 
-[3.593813663804629410e+00, 2.798826150195019707e-02, 4.040110044026286318e-02], 
-[3.593813663804629410e+00, 3.215633811115024138e-02, 4.052109427249563078e-02], 
-[3.593813663804629410e+00, 3.694513432520856594e-02, 4.066952247020043376e-02], 
-[3.593813663804629410e+00, 4.244708914272822542e-02, 4.085172906667977610e-02], 
-[3.593813663804629410e+00, 4.876840779169493850e-02, 4.107424654965649569e-02], 
-[3.593813663804629410e+00, 5.603111182818285713e-02, 4.134511810540844601e-02], 
-[3.593813663804629410e+00, 6.437539454049952259e-02, 4.167432565437900749e-02], 
-[3.593813663804629410e+00, 7.396232712556144451e-02, 4.207436487873245090e-02], 
-[3.593813663804629410e+00, 8.497696787531199003e-02, 4.256102727230501315e-02], 
-[3.593813663804629410e+00, 9.763193439036874088e-02, 4.315447816735533404e-02], 
-[3.593813663804629410e+00, 1.121715077759858903e-01, 4.388076506503547913e-02], 
-[3.593813663804629410e+00, 1.288763480443681220e-01, 4.477396346547336814e-02], 
-[3.593813663804629410e+00, 1.480689117455977755e-01, 4.587928755733004793e-02], 
-[3.593813663804629410e+00, 1.701196764046864207e-01, 4.725769729168303318e-02], 
-[3.593813663804629410e+00, 1.954542919161802172e-01, 4.899289224216117622e-02], 
-[3.593813663804629410e+00, 2.245617969409859638e-01, 5.120223853532272773e-02], 
-[3.593813663804629410e+00, 2.580040589080049296e-01, 5.405442908330545387e-02], 
-[3.593813663804629410e+00, 2.964266198426381838e-01, 5.779920459066245630e-02], 
-[3.593813663804629410e+00, 3.405711573811430193e-01, 6.281988557248710525e-02], 
-[3.593813663804629410e+00, 3.912898015080607528e-01, 6.973201676628103252e-02], 
-[3.593813663804629410e+00, 4.495615833752782953e-01, 7.958332749178165244e-02], 
-[3.593813663804629410e+00, 5.165113337172515529e-01, 9.430158265783669669e-02], 
-[3.593813663804629410e+00, 5.934313956619206021e-01, 1.178436291927670576e-01], 
-[3.593813663804629410e+00, 6.818065710636164178e-01, 1.597885924536179281e-01], 
-[3.593813663804629410e+00, 7.833427819015473803e-01, 2.508635851298269825e-01], 
-[3.593813663804629410e+00, 9.000000000000000222e-01, 5.764236694248626725e-01], 
-[3.593813663804629410e+00, 9.020408163265306589e-01, 5.887690347225141840e-01], 
-[3.593813663804629410e+00, 9.040816326530612956e-01, 6.016223643943295896e-01], 
-[3.593813663804629410e+00, 9.061224489795918213e-01, 6.150159463601492238e-01], 
-[3.593813663804629410e+00, 9.081632653061224580e-01, 6.289848839527931723e-01], 
-[3.593813663804629410e+00, 9.102040816326530948e-01, 6.435674109472611093e-01], 
-[3.593813663804629410e+00, 9.122448979591837315e-01, 6.588052499809434748e-01], 
-[3.593813663804629410e+00, 9.142857142857142572e-01, 6.747440215160215304e-01], 
-[3.593813663804629410e+00, 9.163265306122448939e-01, 6.914337118766589185e-01], 
-[3.593813663804629410e+00, 9.183673469387755306e-01, 7.089292105834557045e-01], 
-[3.593813663804629410e+00, 9.204081632653061673e-01, 7.272909292835598727e-01], 
-[3.593813663804629410e+00, 9.224489795918368040e-01, 7.465855171383015687e-01], 
-[3.593813663804629410e+00, 9.244897959183673297e-01, 7.668866907117370957e-01], 
-[3.593813663804629410e+00, 9.265306122448979664e-01, 7.882762003728938094e-01], 
-[3.593813663804629410e+00, 9.285714285714286031e-01, 8.108449602058642736e-01], 
-[3.593813663804629410e+00, 9.306122448979592399e-01, 8.346943747096852162e-01], 
-[3.593813663804629410e+00, 9.326530612244897656e-01, 8.599379035571110830e-01], 
-[3.593813663804629410e+00, 9.346938775510204023e-01, 8.867029158946587719e-01], 
-[3.593813663804629410e+00, 9.367346938775510390e-01, 9.151328988176217205e-01], 
-[3.593813663804629410e+00, 9.387755102040816757e-01, 9.453901017144286101e-01], 
-[3.593813663804629410e+00, 9.408163265306123124e-01, 9.776587204815845311e-01], 
-[3.593813663804629410e+00, 9.428571428571428381e-01, 1.012148755020985336e+00], 
-[3.593813663804629410e+00, 9.448979591836734748e-01, 1.049100712555335546e+00], 
-[3.593813663804629410e+00, 9.469387755102041115e-01, 1.088791381837463046e+00], 
-[3.593813663804629410e+00, 9.489795918367347483e-01, 1.131540974607779138e+00], 
-[3.593813663804629410e+00, 9.510204081632652739e-01, 1.177722028410139066e+00], 
-[3.593813663804629410e+00, 9.530612244897959107e-01, 1.227770600523414135e+00], 
-[3.593813663804629410e+00, 9.551020408163265474e-01, 1.282200473376716499e+00], 
-[3.593813663804629410e+00, 9.571428571428571841e-01, 1.341621363334399852e+00], 
-[3.593813663804629410e+00, 9.591836734693878208e-01, 1.406762517258103529e+00], 
-[3.593813663804629410e+00, 9.612244897959183465e-01, 1.478503657895570811e+00], 
-[3.593813663804629410e+00, 9.632653061224489832e-01, 1.557916101275808263e+00], 
-[3.593813663804629410e+00, 9.653061224489796199e-01, 1.646318183312245997e+00], 
-[3.593813663804629410e+00, 9.673469387755102566e-01, 1.745351178558721017e+00], 
-[3.593813663804629410e+00, 9.693877551020407823e-01, 1.857085154780471203e+00], 
-[3.593813663804629410e+00, 9.714285714285714191e-01, 1.984169542306887246e+00], 
-[3.593813663804629410e+00, 9.734693877551020558e-01, 2.130052187470214520e+00], 
-[3.593813663804629410e+00, 9.755102040816326925e-01, 2.299306320735643894e+00], 
-[3.593813663804629410e+00, 9.775510204081632182e-01, 2.498133206018210650e+00], 
-[3.593813663804629410e+00, 9.795918367346938549e-01, 2.735161792272184922e+00], 
-[3.593813663804629410e+00, 9.816326530612244916e-01, 3.022773185525947426e+00], 
-[3.593813663804629410e+00, 9.836734693877551283e-01, 3.379402651136242497e+00], 
-[3.593813663804629410e+00, 9.857142857142857650e-01, 3.833782342215001471e+00], 
-[3.593813663804629410e+00, 9.877551020408162907e-01, 4.433354287640768554e+00], 
-[3.593813663804629410e+00, 9.897959183673469274e-01, 5.262597615326598977e+00], 
-[3.593813663804629410e+00, 9.918367346938775642e-01, 6.488317904288647853e+00], 
-[3.593813663804629410e+00, 9.938775510204082009e-01, 8.493592903673379269e+00], 
-[3.593813663804629410e+00, 9.959183673469387266e-01, 1.240357151980824568e+01], 
-[3.593813663804629410e+00, 9.979591836734693633e-01, 2.365916433360698434e+01], 
-[3.593813663804629410e+00, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[3.944206059437660006e+00, 1.000000000000000021e-03, 4.082313186463315535e-02], 
-[3.944206059437660006e+00, 1.148922311909569708e-03, 4.077853167103148713e-02], 
-[3.944206059437660006e+00, 1.320022478803632065e-03, 4.073476010421532567e-02], 
-[3.944206059437660006e+00, 1.516603278119670137e-03, 4.069194079189987490e-02], 
-[3.944206059437660006e+00, 1.742459344546885402e-03, 4.065021603182046583e-02], 
-[3.944206059437660006e+00, 2.001950418545241171e-03, 4.060974968269669833e-02], 
-[3.944206059437660006e+00, 2.300085503203331758e-03, 4.057073052523612472e-02], 
-[3.944206059437660006e+00, 2.642619553930058204e-03, 4.053337617656103953e-02], 
-[3.944206059437660006e+00, 3.036164567398761706e-03, 4.049793765819788977e-02], 
-[3.944206059437660006e+00, 3.488317214113704091e-03, 4.046470473873413354e-02], 
-[3.944206059437660006e+00, 4.007805478313466660e-03, 4.043401219782399858e-02], 
-[3.944206059437660006e+00, 4.604657135827751671e-03, 4.040624719091785721e-02], 
-[3.944206059437660006e+00, 5.290393322046124149e-03, 4.038185793454433098e-02], 
-[3.944206059437660006e+00, 6.078250926476181683e-03, 4.036136398358639715e-02], 
-[3.944206059437660006e+00, 6.983438106813499684e-03, 4.034536843756654501e-02], 
-[3.944206059437660006e+00, 8.023427854757562983e-03, 4.033457249696222047e-02], 
-[3.944206059437660006e+00, 9.218295280327699903e-03, 4.032979289901085507e-02], 
-[3.944206059437660006e+00, 1.059110512533918171e-02, 4.033198290284432941e-02], 
-[3.944206059437660006e+00, 1.216835698628199354e-02, 4.034225767754377745e-02], 
-[3.944206059437660006e+00, 1.398049684082008047e-02, 4.036192518781747673e-02], 
-[3.944206059437660006e+00, 1.606250475199945058e-02, 4.039252399134875271e-02], 
-[3.944206059437660006e+00, 1.845457009472566828e-02, 4.043586978740221216e-02], 
-[3.944206059437660006e+00, 2.120286733852943389e-02, 4.049411312769174431e-02], 
-[3.944206059437660006e+00, 2.436044736169515681e-02, 4.056981147383104114e-02], 
-[3.944206059437660006e+00, 2.798826150195019707e-02, 4.066601984103033335e-02], 
-[3.944206059437660006e+00, 3.215633811115024138e-02, 4.078640572088733374e-02], 
-[3.944206059437660006e+00, 3.694513432520856594e-02, 4.093539599665413364e-02], 
-[3.944206059437660006e+00, 4.244708914272822542e-02, 4.111836640331661963e-02], 
-[3.944206059437660006e+00, 4.876840779169493850e-02, 4.134188812007200120e-02], 
-[3.944206059437660006e+00, 5.603111182818285713e-02, 4.161405189083404454e-02], 
-[3.944206059437660006e+00, 6.437539454049952259e-02, 4.194489854507937876e-02], 
-[3.944206059437660006e+00, 7.396232712556144451e-02, 4.234699735362221912e-02], 
-[3.944206059437660006e+00, 8.497696787531199003e-02, 4.283623258950498836e-02], 
-[3.944206059437660006e+00, 9.763193439036874088e-02, 4.343288774968061955e-02], 
-[3.944206059437660006e+00, 1.121715077759858903e-01, 4.416316251792192643e-02], 
-[3.944206059437660006e+00, 1.288763480443681220e-01, 4.506133082152868896e-02], 
-[3.944206059437660006e+00, 1.480689117455977755e-01, 4.617286915985754220e-02], 
-[3.944206059437660006e+00, 1.701196764046864207e-01, 4.755908966557254036e-02], 
-[3.944206059437660006e+00, 1.954542919161802172e-01, 4.930417319044156504e-02], 
-[3.944206059437660006e+00, 2.245617969409859638e-01, 5.152615713879193926e-02], 
-[3.944206059437660006e+00, 2.580040589080049296e-01, 5.439469346120567178e-02], 
-[3.944206059437660006e+00, 2.964266198426381838e-01, 5.816093295203349223e-02], 
-[3.944206059437660006e+00, 3.405711573811430193e-01, 6.321034348467047259e-02], 
-[3.944206059437660006e+00, 3.912898015080607528e-01, 7.016188688182627142e-02], 
-[3.944206059437660006e+00, 4.495615833752782953e-01, 8.006904722977145616e-02], 
-[3.944206059437660006e+00, 5.165113337172515529e-01, 9.487004461412337775e-02], 
-[3.944206059437660006e+00, 5.934313956619206021e-01, 1.185428555362541270e-01], 
-[3.944206059437660006e+00, 6.818065710636164178e-01, 1.607167516291380382e-01], 
-[3.944206059437660006e+00, 7.833427819015473803e-01, 2.522752972508781610e-01], 
-[3.944206059437660006e+00, 9.000000000000000222e-01, 5.794722675392318667e-01], 
-[3.944206059437660006e+00, 9.020408163265306589e-01, 5.918777389724201310e-01], 
-[3.944206059437660006e+00, 9.040816326530612956e-01, 6.047935269700507321e-01], 
-[3.944206059437660006e+00, 9.061224489795918213e-01, 6.182520638719707362e-01], 
-[3.944206059437660006e+00, 9.081632653061224580e-01, 6.322886096931639166e-01], 
-[3.944206059437660006e+00, 9.102040816326530948e-01, 6.469415684953232493e-01], 
-[3.944206059437660006e+00, 9.122448979591837315e-01, 6.622528483309062519e-01], 
-[3.944206059437660006e+00, 9.142857142857142572e-01, 6.782682719402559623e-01], 
-[3.944206059437660006e+00, 9.163265306122448939e-01, 6.950380467694154962e-01], 
-[3.944206059437660006e+00, 9.183673469387755306e-01, 7.126173045729788935e-01], 
-[3.944206059437660006e+00, 9.204081632653061673e-01, 7.310667229505156683e-01], 
-[3.944206059437660006e+00, 9.224489795918368040e-01, 7.504532437391135957e-01], 
-[3.944206059437660006e+00, 9.244897959183673297e-01, 7.708509063785877746e-01], 
-[3.944206059437660006e+00, 9.265306122448979664e-01, 7.923418183514168156e-01], 
-[3.944206059437660006e+00, 9.285714285714286031e-01, 8.150172898005960676e-01], 
-[3.944206059437660006e+00, 9.306122448979592399e-01, 8.389791657414289450e-01], 
-[3.944206059437660006e+00, 9.326530612244897656e-01, 8.643413973021375485e-01], 
-[3.944206059437660006e+00, 9.346938775510204023e-01, 8.912319036818440177e-01], 
-[3.944206059437660006e+00, 9.367346938775510390e-01, 9.197947897176301790e-01], 
-[3.944206059437660006e+00, 9.387755102040816757e-01, 9.501930010801344917e-01], 
-[3.944206059437660006e+00, 9.408163265306123124e-01, 9.826115215113573331e-01], 
-[3.944206059437660006e+00, 9.428571428571428381e-01, 1.017261246043711376e+00], 
-[3.944206059437660006e+00, 9.448979591836734748e-01, 1.054383703415451734e+00], 
-[3.944206059437660006e+00, 9.469387755102041115e-01, 1.094256853641259131e+00], 
-[3.944206059437660006e+00, 9.489795918367347483e-01, 1.137202258250331610e+00], 
-[3.944206059437660006e+00, 9.510204081632652739e-01, 1.183594018836140904e+00], 
-[3.944206059437660006e+00, 9.530612244897959107e-01, 1.233870015728331548e+00], 
-[3.944206059437660006e+00, 9.551020408163265474e-01, 1.288546169934364549e+00], 
-[3.944206059437660006e+00, 9.571428571428571841e-01, 1.348234724046815991e+00], 
-[3.944206059437660006e+00, 9.591836734693878208e-01, 1.413667931815457024e+00], 
-[3.944206059437660006e+00, 9.612244897959183465e-01, 1.485729124892035236e+00], 
-[3.944206059437660006e+00, 9.632653061224489832e-01, 1.565493990607273123e+00], 
-[3.944206059437660006e+00, 9.653061224489796199e-01, 1.654286213544766238e+00], 
-[3.944206059437660006e+00, 9.673469387755102566e-01, 1.753753686977101989e+00], 
-[3.944206059437660006e+00, 9.693877551020407823e-01, 1.865974772917459390e+00], 
-[3.944206059437660006e+00, 9.714285714285714191e-01, 1.993609444300823652e+00], 
-[3.944206059437660006e+00, 9.734693877551020558e-01, 2.140119165698383341e+00], 
-[3.944206059437660006e+00, 9.755102040816326925e-01, 2.310095086542598875e+00], 
-[3.944206059437660006e+00, 9.775510204081632182e-01, 2.509762557704307895e+00], 
-[3.944206059437660006e+00, 9.795918367346938549e-01, 2.747783725982625658e+00], 
-[3.944206059437660006e+00, 9.816326530612244916e-01, 3.036586830560944250e+00], 
-[3.944206059437660006e+00, 9.836734693877551283e-01, 3.394676494969647074e+00], 
-[3.944206059437660006e+00, 9.857142857142857650e-01, 3.850891538615389020e+00], 
-[3.944206059437660006e+00, 9.877551020408162907e-01, 4.452847437008744080e+00], 
-[3.944206059437660006e+00, 9.897959183673469274e-01, 5.285326657550708518e+00], 
-[3.944206059437660006e+00, 9.918367346938775642e-01, 6.515720795067884374e+00], 
-[3.944206059437660006e+00, 9.938775510204082009e-01, 8.528416624513539546e+00], 
-[3.944206059437660006e+00, 9.959183673469387266e-01, 1.245226389147469348e+01], 
-[3.944206059437660006e+00, 9.979591836734693633e-01, 2.374497334158553485e+01], 
-[3.944206059437660006e+00, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[4.328761281083061796e+00, 1.000000000000000021e-03, 4.109721508955829772e-02], 
-[4.328761281083061796e+00, 1.148922311909569708e-03, 4.105201491539783865e-02], 
-[4.328761281083061796e+00, 1.320022478803632065e-03, 4.100764841930469584e-02], 
-[4.328761281083061796e+00, 1.516603278119670137e-03, 4.096423997652993976e-02], 
-[4.328761281083061796e+00, 1.742459344546885402e-03, 4.092193274434685613e-02], 
-[4.328761281083061796e+00, 2.001950418545241171e-03, 4.088089157022956749e-02], 
-[4.328761281083061796e+00, 2.300085503203331758e-03, 4.084130637285537935e-02], 
-[4.328761281083061796e+00, 2.642619553930058204e-03, 4.080339607980311423e-02], 
-[4.328761281083061796e+00, 3.036164567398761706e-03, 4.076741322267994627e-02], 
-[4.328761281083061796e+00, 3.488317214113704091e-03, 4.073364931148731188e-02], 
-[4.328761281083061796e+00, 4.007805478313466660e-03, 4.070244113578172507e-02], 
-[4.328761281083061796e+00, 4.604657135827751671e-03, 4.067417817305053057e-02], 
-[4.328761281083061796e+00, 5.290393322046124149e-03, 4.064931132542877468e-02], 
-[4.328761281083061796e+00, 6.078250926476181683e-03, 4.062836325779199675e-02], 
-[4.328761281083061796e+00, 6.983438106813499684e-03, 4.061194067621788639e-02], 
-[4.328761281083061796e+00, 8.023427854757562983e-03, 4.060074897030849228e-02], 
-[4.328761281083061796e+00, 9.218295280327699903e-03, 4.059560975192930826e-02], 
-[4.328761281083061796e+00, 1.059110512533918171e-02, 4.059748196413126564e-02], 
-[4.328761281083061796e+00, 1.216835698628199354e-02, 4.060748741882768548e-02], 
-[4.328761281083061796e+00, 1.398049684082008047e-02, 4.062694186431865806e-02], 
-[4.328761281083061796e+00, 1.606250475199945058e-02, 4.065739300494485009e-02], 
-[4.328761281083061796e+00, 1.845457009472566828e-02, 4.070066732315303498e-02], 
-[4.328761281083061796e+00, 2.120286733852943389e-02, 4.075892812896447087e-02], 
-[4.328761281083061796e+00, 2.436044736169515681e-02, 4.083474803959899480e-02], 
-[4.328761281083061796e+00, 2.798826150195019707e-02, 4.093120015340087625e-02], 
-[4.328761281083061796e+00, 3.215633811115024138e-02, 4.105197364370249957e-02], 
-[4.328761281083061796e+00, 3.694513432520856594e-02, 4.120152153030642861e-02], 
-[4.328761281083061796e+00, 4.244708914272822542e-02, 4.138525124134860567e-02], 
-[4.328761281083061796e+00, 4.876840779169493850e-02, 4.160977263638807044e-02], 
-[4.328761281083061796e+00, 5.603111182818285713e-02, 4.188322400237046161e-02], 
-[4.328761281083061796e+00, 6.437539454049952259e-02, 4.221570505841762411e-02], 
-[4.328761281083061796e+00, 7.396232712556144451e-02, 4.261985863796641238e-02], 
-[4.328761281083061796e+00, 8.497696787531199003e-02, 4.311166175790109856e-02], 
-[4.328761281083061796e+00, 9.763193439036874088e-02, 4.371151603118590689e-02], 
-[4.328761281083061796e+00, 1.121715077759858903e-01, 4.444577325624400610e-02], 
-[4.328761281083061796e+00, 1.288763480443681220e-01, 4.534890569118656817e-02], 
-[4.328761281083061796e+00, 1.480689117455977755e-01, 4.646665200715981159e-02], 
-[4.328761281083061796e+00, 1.701196764046864207e-01, 4.786067631446552784e-02], 
-[4.328761281083061796e+00, 1.954542919161802172e-01, 4.961564043735158802e-02], 
-[4.328761281083061796e+00, 2.245617969409859638e-01, 5.185025258901030526e-02], 
-[4.328761281083061796e+00, 2.580040589080049296e-01, 5.473512301942877467e-02], 
-[4.328761281083061796e+00, 2.964266198426381838e-01, 5.852281141009195442e-02], 
-[4.328761281083061796e+00, 3.405711573811430193e-01, 6.360093095815907982e-02], 
-[4.328761281083061796e+00, 3.912898015080607528e-01, 7.059185695938807736e-02], 
-[4.328761281083061796e+00, 4.495615833752782953e-01, 8.055482144276301937e-02], 
-[4.328761281083061796e+00, 5.165113337172515529e-01, 9.543848566552858015e-02], 
-[4.328761281083061796e+00, 5.934313956619206021e-01, 1.192419234082572055e-01], 
-[4.328761281083061796e+00, 6.818065710636164178e-01, 1.616444637730223843e-01], 
-[4.328761281083061796e+00, 7.833427819015473803e-01, 2.536857925381913459e-01], 
-[4.328761281083061796e+00, 9.000000000000000222e-01, 5.825159602768622547e-01], 
-[4.328761281083061796e+00, 9.020408163265306589e-01, 5.949813785194039140e-01], 
-[4.328761281083061796e+00, 9.040816326530612956e-01, 6.079594577906510811e-01], 
-[4.328761281083061796e+00, 9.061224489795918213e-01, 6.214827743124800019e-01], 
-[4.328761281083061796e+00, 9.081632653061224580e-01, 6.355867441942095741e-01], 
-[4.328761281083061796e+00, 9.102040816326530948e-01, 6.503099411407176067e-01], 
-[4.328761281083061796e+00, 9.122448979591837315e-01, 6.656944579136679918e-01], 
-[4.328761281083061796e+00, 9.142857142857142572e-01, 6.817863187557149374e-01], 
-[4.328761281083061796e+00, 9.163265306122448939e-01, 6.986359513801592147e-01], 
-[4.328761281083061796e+00, 9.183673469387755306e-01, 7.162987288320450396e-01], 
-[4.328761281083061796e+00, 9.204081632653061673e-01, 7.348355936192161320e-01], 
-[4.328761281083061796e+00, 9.224489795918368040e-01, 7.543137790961105260e-01], 
-[4.328761281083061796e+00, 9.244897959183673297e-01, 7.748076462897858230e-01], 
-[4.328761281083061796e+00, 9.265306122448979664e-01, 7.963996583589724176e-01], 
-[4.328761281083061796e+00, 9.285714285714286031e-01, 8.191815198978658064e-01], 
-[4.328761281083061796e+00, 9.306122448979592399e-01, 8.432555146340775520e-01], 
-[4.328761281083061796e+00, 9.326530612244897656e-01, 8.687360831205557243e-01], 
-[4.328761281083061796e+00, 9.346938775510204023e-01, 8.957516923151291888e-01], 
-[4.328761281083061796e+00, 9.367346938775510390e-01, 9.244470621960667600e-01], 
-[4.328761281083061796e+00, 9.387755102040816757e-01, 9.549858317564764443e-01], 
-[4.328761281083061796e+00, 9.408163265306123124e-01, 9.875537692014826341e-01], 
-[4.328761281083061796e+00, 9.428571428571428381e-01, 1.022362660811650059e+00], 
-[4.328761281083061796e+00, 9.448979591836734748e-01, 1.059655052363540850e+00], 
-[4.328761281083061796e+00, 9.469387755102041115e-01, 1.099710069944381807e+00], 
-[4.328761281083061796e+00, 9.489795918367347483e-01, 1.142850618824946318e+00], 
-[4.328761281083061796e+00, 9.510204081632652739e-01, 1.189452357560237150e+00], 
-[4.328761281083061796e+00, 9.530612244897959107e-01, 1.239954981170158232e+00], 
-[4.328761281083061796e+00, 9.551020408163265474e-01, 1.294876539311741848e+00], 
-[4.328761281083061796e+00, 9.571428571428571841e-01, 1.354831788926904146e+00], 
-[4.328761281083061796e+00, 9.591836734693878208e-01, 1.420555976326191017e+00], 
-[4.328761281083061796e+00, 9.612244897959183465e-01, 1.492936024631107195e+00], 
-[4.328761281083061796e+00, 9.632653061224489832e-01, 1.573051971051393494e+00], 
-[4.328761281083061796e+00, 9.653061224489796199e-01, 1.662232822231874074e+00], 
-[4.328761281083061796e+00, 9.673469387755102566e-01, 1.762133056714505930e+00], 
-[4.328761281083061796e+00, 9.693877551020407823e-01, 1.874839288144243721e+00], 
-[4.328761281083061796e+00, 9.714285714285714191e-01, 2.003021976939920457e+00], 
-[4.328761281083061796e+00, 9.734693877551020558e-01, 2.150156133381149193e+00], 
-[4.328761281083061796e+00, 9.755102040816326925e-01, 2.320850728537121821e+00], 
-[4.328761281083061796e+00, 9.775510204081632182e-01, 2.521355066622462449e+00], 
-[4.328761281083061796e+00, 9.795918367346938549e-01, 2.760364303919290663e+00], 
-[4.328761281083061796e+00, 9.816326530612244916e-01, 3.050353538702908818e+00], 
-[4.328761281083061796e+00, 9.836734693877551283e-01, 3.409896338433507701e+00], 
-[4.328761281083061796e+00, 9.857142857142857650e-01, 3.867937532595310035e+00], 
-[4.328761281083061796e+00, 9.877551020408162907e-01, 4.472264940246048148e+00], 
-[4.328761281083061796e+00, 9.897959183673469274e-01, 5.307962364474040129e+00], 
-[4.328761281083061796e+00, 9.918367346938775642e-01, 6.543003368460925451e+00], 
-[4.328761281083061796e+00, 9.938775510204082009e-01, 8.563074205687781770e+00], 
-[4.328761281083061796e+00, 9.959183673469387266e-01, 1.250069646640304555e+01], 
-[4.328761281083061796e+00, 9.979591836734693633e-01, 2.383023397477462169e+01], 
-[4.328761281083061796e+00, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[4.750810162102798273e+00, 1.000000000000000021e-03, 4.137166390597733778e-02], 
-[4.750810162102798273e+00, 1.148922311909569708e-03, 4.132585940032142829e-02], 
-[4.750810162102798273e+00, 1.320022478803632065e-03, 4.128089362457611211e-02], 
-[4.750810162102798273e+00, 1.516603278119670137e-03, 4.123689170154279382e-02], 
-[4.750810162102798273e+00, 1.742459344546885402e-03, 4.119399764803902131e-02], 
-[4.750810162102798273e+00, 2.001950418545241171e-03, 4.115237730028918628e-02], 
-[4.750810162102798273e+00, 2.300085503203331758e-03, 4.111222171492208421e-02], 
-[4.750810162102798273e+00, 2.642619553930058204e-03, 4.107375112993677524e-02], 
-[4.750810162102798273e+00, 3.036164567398761706e-03, 4.103721958696184002e-02], 
-[4.750810162102798273e+00, 3.488317214113704091e-03, 4.100292033732420849e-02], 
-[4.750810162102798273e+00, 4.007805478313466660e-03, 4.097119218035756572e-02], 
-[4.750810162102798273e+00, 4.604657135827751671e-03, 4.094242691541515738e-02], 
-[4.750810162102798273e+00, 5.290393322046124149e-03, 4.091707813001023430e-02], 
-[4.750810162102798273e+00, 6.078250926476181683e-03, 4.089567159871160262e-02], 
-[4.750810162102798273e+00, 6.983438106813499684e-03, 4.087881763376469135e-02], 
-[4.750810162102798273e+00, 8.023427854757562983e-03, 4.086722581339924387e-02], 
-[4.750810162102798273e+00, 9.218295280327699903e-03, 4.086172262347646800e-02], 
-[4.750810162102798273e+00, 1.059110512533918171e-02, 4.086327269016538921e-02], 
-[4.750810162102798273e+00, 1.216835698628199354e-02, 4.087300446720107394e-02], 
-[4.750810162102798273e+00, 1.398049684082008047e-02, 4.089224148520333169e-02], 
-[4.750810162102798273e+00, 1.606250475199945058e-02, 4.092254059357001983e-02], 
-[4.750810162102798273e+00, 1.845457009472566828e-02, 4.096573905591684162e-02], 
-[4.750810162102798273e+00, 2.120286733852943389e-02, 4.102401293803534937e-02], 
-[4.750810162102798273e+00, 2.436044736169515681e-02, 4.109995000954611011e-02], 
-[4.750810162102798273e+00, 2.798826150195019707e-02, 4.119664144786217702e-02], 
-[4.750810162102798273e+00, 3.215633811115024138e-02, 4.131779810286961840e-02], 
-[4.750810162102798273e+00, 3.694513432520856594e-02, 4.146789912427902014e-02], 
-[4.750810162102798273e+00, 4.244708914272822542e-02, 4.165238362479958822e-02], 
-[4.750810162102798273e+00, 4.876840779169493850e-02, 4.187790013318751919e-02], 
-[4.750810162102798273e+00, 5.603111182818285713e-02, 4.215263446475327885e-02], 
-[4.750810162102798273e+00, 6.437539454049952259e-02, 4.248674520879898442e-02], 
-[4.750810162102798273e+00, 7.396232712556144451e-02, 4.289294873526290630e-02], 
-[4.750810162102798273e+00, 8.497696787531199003e-02, 4.338731476939083898e-02], 
-[4.750810162102798273e+00, 9.763193439036874088e-02, 4.399036299133135541e-02], 
-[4.750810162102798273e+00, 1.121715077759858903e-01, 4.472859724600780629e-02], 
-[4.750810162102798273e+00, 1.288763480443681220e-01, 4.563668802575546191e-02], 
-[4.750810162102798273e+00, 1.480689117455977755e-01, 4.676063603431643290e-02], 
-[4.750810162102798273e+00, 1.701196764046864207e-01, 4.816245715531312921e-02], 
-[4.750810162102798273e+00, 1.954542919161802172e-01, 4.992729387933966118e-02], 
-[4.750810162102798273e+00, 2.245617969409859638e-01, 5.217452475893323560e-02], 
-[4.750810162102798273e+00, 2.580040589080049296e-01, 5.507571760364500524e-02], 
-[4.750810162102798273e+00, 2.964266198426381838e-01, 5.888483977838866040e-02], 
-[4.750810162102798273e+00, 3.405711573811430193e-01, 6.399164776821794631e-02], 
-[4.750810162102798273e+00, 3.912898015080607528e-01, 7.102192672816404206e-02], 
-[4.750810162102798273e+00, 4.495615833752782953e-01, 8.104064980447160671e-02], 
-[4.750810162102798273e+00, 5.165113337172515529e-01, 9.600690542051112941e-02], 
-[4.750810162102798273e+00, 5.934313956619206021e-01, 1.199408323487535510e-01], 
-[4.750810162102798273e+00, 6.818065710636164178e-01, 1.625717283945079528e-01], 
-[4.750810162102798273e+00, 7.833427819015473803e-01, 2.550950707668639961e-01], 
-[4.750810162102798273e+00, 9.000000000000000222e-01, 5.855547511272255479e-01], 
-[4.750810162102798273e+00, 9.020408163265306589e-01, 5.980799570625480177e-01], 
-[4.750810162102798273e+00, 9.040816326530612956e-01, 6.111201607780759604e-01], 
-[4.750810162102798273e+00, 9.061224489795918213e-01, 6.247080818408081715e-01], 
-[4.750810162102798273e+00, 9.081632653061224580e-01, 6.388792918677536070e-01], 
-[4.750810162102798273e+00, 9.102040816326530948e-01, 6.536725335647699531e-01], 
-[4.750810162102798273e+00, 9.122448979591837315e-01, 6.691300836983122835e-01], 
-[4.750810162102798273e+00, 9.142857142857142572e-01, 6.852981672390926482e-01], 
-[4.750810162102798273e+00, 9.163265306122448939e-01, 7.022274313148422209e-01], 
-[4.750810162102798273e+00, 9.183673469387755306e-01, 7.199734893194948970e-01], 
-[4.750810162102798273e+00, 9.204081632653061673e-01, 7.385975476272331752e-01], 
-[4.750810162102798273e+00, 9.224489795918368040e-01, 7.581671299539288755e-01], 
-[4.750810162102798273e+00, 9.244897959183673297e-01, 7.787569176281594618e-01], 
-[4.750810162102798273e+00, 9.265306122448979664e-01, 8.004497280508562351e-01], 
-[4.750810162102798273e+00, 9.285714285714286031e-01, 8.233376586632685790e-01], 
-[4.750810162102798273e+00, 9.306122448979592399e-01, 8.475234301053906627e-01], 
-[4.750810162102798273e+00, 9.326530612244897656e-01, 8.731219703287422806e-01], 
-[4.750810162102798273e+00, 9.346938775510204023e-01, 9.002622917611999842e-01], 
-[4.750810162102798273e+00, 9.367346938775510390e-01, 9.290897269276223724e-01], 
-[4.750810162102798273e+00, 9.387755102040816757e-01, 9.597686051907564631e-01], 
-[4.750810162102798273e+00, 9.408163265306123124e-01, 9.924854758444661140e-01], 
-[4.750810162102798273e+00, 9.428571428571428381e-01, 1.027453012544376820e+00], 
-[4.750810162102798273e+00, 9.448979591836734748e-01, 1.064914773638941492e+00], 
-[4.750810162102798273e+00, 9.469387755102041115e-01, 1.105151046111320978e+00], 
-[4.750810162102798273e+00, 9.489795918367347483e-01, 1.148486072941631742e+00], 
-[4.750810162102798273e+00, 9.510204081632652739e-01, 1.195297062576111458e+00], 
-[4.750810162102798273e+00, 9.530612244897959107e-01, 1.246025516385659948e+00], 
-[4.750810162102798273e+00, 9.551020408163265474e-01, 1.301191602773681844e+00], 
-[4.750810162102798273e+00, 9.571428571428571841e-01, 1.361412581183579107e+00], 
-[4.750810162102798273e+00, 9.591836734693878208e-01, 1.427426676197276256e+00], 
-[4.750810162102798273e+00, 9.612244897959183465e-01, 1.500124385018657858e+00], 
-[4.750810162102798273e+00, 9.632653061224489832e-01, 1.580590073372265758e+00], 
-[4.750810162102798273e+00, 9.653061224489796199e-01, 1.670158043428996653e+00], 
-[4.750810162102798273e+00, 9.673469387755102566e-01, 1.770489325645078882e+00], 
-[4.750810162102798273e+00, 9.693877551020407823e-01, 1.883678742803251094e+00], 
-[4.750810162102798273e+00, 9.714285714285714191e-01, 2.012407187845310474e+00], 
-[4.750810162102798273e+00, 9.734693877551020558e-01, 2.160163144444428696e+00], 
-[4.750810162102798273e+00, 9.755102040816326925e-01, 2.331573308271117639e+00], 
-[4.750810162102798273e+00, 9.775510204081632182e-01, 2.532910803685376688e+00], 
-[4.750810162102798273e+00, 9.795918367346938549e-01, 2.772903608686617005e+00], 
-[4.750810162102798273e+00, 9.816326530612244916e-01, 3.064073407466968213e+00], 
-[4.750810162102798273e+00, 9.836734693877551283e-01, 3.425062298549458539e+00], 
-[4.750810162102798273e+00, 9.857142857142857650e-01, 3.884920467521088661e+00], 
-[4.750810162102798273e+00, 9.877551020408162907e-01, 4.491606977788277888e+00], 
-[4.750810162102798273e+00, 9.897959183673469274e-01, 5.330504971631960132e+00], 
-[4.750810162102798273e+00, 9.918367346938775642e-01, 6.570165948483420060e+00], 
-[4.750810162102798273e+00, 9.938775510204082009e-01, 8.597566131020963454e+00], 
-[4.750810162102798273e+00, 9.959183673469387266e-01, 1.254887008189684749e+01], 
-[4.750810162102798273e+00, 9.979591836734693633e-01, 2.391494829571364278e+01], 
-[4.750810162102798273e+00, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[5.214008287999689628e+00, 1.000000000000000021e-03, 4.164647856230894313e-02], 
-[5.214008287999689628e+00, 1.148922311909569708e-03, 4.160006536716771841e-02], 
-[5.214008287999689628e+00, 1.320022478803632065e-03, 4.155449595433337306e-02], 
-[5.214008287999689628e+00, 1.516603278119670137e-03, 4.150989619417074644e-02], 
-[5.214008287999689628e+00, 1.742459344546885402e-03, 4.146641096304666541e-02], 
-[5.214008287999689628e+00, 2.001950418545241171e-03, 4.142420708592994827e-02], 
-[5.214008287999689628e+00, 2.300085503203331758e-03, 4.138347675738074383e-02], 
-[5.214008287999689628e+00, 2.642619553930058204e-03, 4.134444152578006793e-02], 
-[5.214008287999689628e+00, 3.036164567398761706e-03, 4.130735694271610303e-02], 
-[5.214008287999689628e+00, 3.488317214113704091e-03, 4.127251800075015103e-02], 
-[5.214008287999689628e+00, 4.007805478313466660e-03, 4.124026550886474018e-02], 
-[5.214008287999689628e+00, 4.604657135827751671e-03, 4.121099358810438595e-02], 
-[5.214008287999689628e+00, 5.290393322046124149e-03, 4.118515851112815318e-02], 
-[5.214008287999689628e+00, 6.078250926476181683e-03, 4.116328916189408715e-02], 
-[5.214008287999689628e+00, 6.983438106813499684e-03, 4.114599945842236511e-02], 
-[5.214008287999689628e+00, 8.023427854757562983e-03, 4.113400316706726512e-02], 
-[5.214008287999689628e+00, 9.218295280327699903e-03, 4.112813164704581803e-02], 
-[5.214008287999689628e+00, 1.059110512533918171e-02, 4.112935520683590196e-02], 
-[5.214008287999689628e+00, 1.216835698628199354e-02, 4.113880894097390883e-02], 
-[5.214008287999689628e+00, 1.398049684082008047e-02, 4.115782416111579689e-02], 
-[5.214008287999689628e+00, 1.606250475199945058e-02, 4.118796686010311320e-02], 
-[5.214008287999689628e+00, 1.845457009472566828e-02, 4.123108508069152356e-02], 
-[5.214008287999689628e+00, 2.120286733852943389e-02, 4.128936764188749498e-02], 
-[5.214008287999689628e+00, 2.436044736169515681e-02, 4.136541746248521834e-02], 
-[5.214008287999689628e+00, 2.798826150195019707e-02, 4.146234379487574728e-02], 
-[5.214008287999689628e+00, 3.215633811115024138e-02, 4.158387916028745412e-02], 
-[5.214008287999689628e+00, 3.694513432520856594e-02, 4.173452883166033078e-02], 
-[5.214008287999689628e+00, 4.244708914272822542e-02, 4.191976359765675619e-02], 
-[5.214008287999689628e+00, 4.876840779169493850e-02, 4.214627064501336173e-02], 
-[5.214008287999689628e+00, 5.603111182818285713e-02, 4.242228330267529268e-02], 
-[5.214008287999689628e+00, 6.437539454049952259e-02, 4.275801901058330634e-02], 
-[5.214008287999689628e+00, 7.396232712556144451e-02, 4.316626764896190627e-02], 
-[5.214008287999689628e+00, 8.497696787531199003e-02, 4.366319161582232072e-02], 
-[5.214008287999689628e+00, 9.763193439036874088e-02, 4.426942860952669256e-02], 
-[5.214008287999689628e+00, 1.121715077759858903e-01, 4.501163445316871958e-02], 
-[5.214008287999689628e+00, 1.288763480443681220e-01, 4.592467777649409527e-02], 
-[5.214008287999689628e+00, 1.480689117455977755e-01, 4.705482117635968048e-02], 
-[5.214008287999689628e+00, 1.701196764046864207e-01, 4.846443210502368593e-02], 
-[5.214008287999689628e+00, 1.954542919161802172e-01, 5.023913341281877054e-02], 
-[5.214008287999689628e+00, 2.245617969409859638e-01, 5.249897352149224261e-02], 
-[5.214008287999689628e+00, 2.580040589080049296e-01, 5.541647705951800035e-02], 
-[5.214008287999689628e+00, 2.964266198426381838e-01, 5.924701787049371088e-02], 
-[5.214008287999689628e+00, 3.405711573811430193e-01, 6.438249369017001733e-02], 
-[5.214008287999689628e+00, 3.912898015080607528e-01, 7.145209591746844169e-02], 
-[5.214008287999689628e+00, 4.495615833752782953e-01, 8.152653198882045538e-02], 
-[5.214008287999689628e+00, 5.165113337172515529e-01, 9.657530348788523344e-02], 
-[5.214008287999689628e+00, 5.934313956619206021e-01, 1.206395818983254514e-01], 
-[5.214008287999689628e+00, 6.818065710636164178e-01, 1.634985450038906885e-01], 
-[5.214008287999689628e+00, 7.833427819015473803e-01, 2.565031317139259137e-01], 
-[5.214008287999689628e+00, 9.000000000000000222e-01, 5.885886435820435469e-01], 
-[5.214008287999689628e+00, 9.020408163265306589e-01, 6.011734783030954210e-01], 
-[5.214008287999689628e+00, 9.040816326530612956e-01, 6.142756398563301579e-01], 
-[5.214008287999689628e+00, 9.061224489795918213e-01, 6.279279906180319504e-01], 
-[5.214008287999689628e+00, 9.081632653061224580e-01, 6.421662571274353581e-01], 
-[5.214008287999689628e+00, 9.102040816326530948e-01, 6.570293504504762794e-01], 
-[5.214008287999689628e+00, 9.122448979591837315e-01, 6.725597306554291777e-01], 
-[5.214008287999689628e+00, 9.142857142857142572e-01, 6.888038226684227716e-01], 
-[5.214008287999689628e+00, 9.163265306122448939e-01, 7.058124921805389862e-01], 
-[5.214008287999689628e+00, 9.183673469387755306e-01, 7.236415919950562881e-01], 
-[5.214008287999689628e+00, 9.204081632653061673e-01, 7.423525913127670961e-01], 
-[5.214008287999689628e+00, 9.224489795918368040e-01, 7.620133030575440003e-01], 
-[5.214008287999689628e+00, 9.244897959183673297e-01, 7.826987275765517893e-01], 
-[5.214008287999689628e+00, 9.265306122448979664e-01, 8.044920350820139454e-01], 
-[5.214008287999689628e+00, 9.285714285714286031e-01, 8.274857142616394157e-01], 
-[5.214008287999689628e+00, 9.306122448979592399e-01, 8.517829208719072120e-01], 
-[5.214008287999689628e+00, 9.326530612244897656e-01, 8.774990682413348342e-01], 
-[5.214008287999689628e+00, 9.346938775510204023e-01, 9.047637119844199605e-01], 
-[5.214008287999689628e+00, 9.367346938775510390e-01, 9.337227945840065324e-01], 
-[5.214008287999689628e+00, 9.387755102040816757e-01, 9.645413328265513009e-01], 
-[5.214008287999689628e+00, 9.408163265306123124e-01, 9.974066537282465505e-01], 
-[5.214008287999689628e+00, 9.428571428571428381e-01, 1.032532314455947731e+00], 
-[5.214008287999689628e+00, 9.448979591836734748e-01, 1.070162881474384875e+00], 
-[5.214008287999689628e+00, 9.469387755102041115e-01, 1.110579797498719268e+00], 
-[5.214008287999689628e+00, 9.489795918367347483e-01, 1.154108637201136212e+00], 
-[5.214008287999689628e+00, 9.510204081632652739e-01, 1.201128151866558635e+00], 
-[5.214008287999689628e+00, 9.530612244897959107e-01, 1.252081640898838222e+00], 
-[5.214008287999689628e+00, 9.551020408163265474e-01, 1.307491381570086597e+00], 
-[5.214008287999689628e+00, 9.571428571428571841e-01, 1.367977124008296075e+00], 
-[5.214008287999689628e+00, 9.591836734693878208e-01, 1.434280056815292692e+00], 
-[5.214008287999689628e+00, 9.612244897959183465e-01, 1.507294233936715244e+00], 
-[5.214008287999689628e+00, 9.632653061224489832e-01, 1.588108328306059747e+00], 
-[5.214008287999689628e+00, 9.653061224489796199e-01, 1.678061911158780006e+00], 
-[5.214008287999689628e+00, 9.673469387755102566e-01, 1.778822531604356438e+00], 
-[5.214008287999689628e+00, 9.693877551020407823e-01, 1.892493179191245822e+00], 
-[5.214008287999689628e+00, 9.714285714285714191e-01, 2.021765124583845719e+00], 
-[5.214008287999689628e+00, 9.734693877551020558e-01, 2.170140252749193088e+00], 
-[5.214008287999689628e+00, 9.755102040816326925e-01, 2.342262887218160117e+00], 
-[5.214008287999689628e+00, 9.775510204081632182e-01, 2.544429839710387498e+00], 
-[5.214008287999689628e+00, 9.795918367346938549e-01, 2.785401722771533084e+00], 
-[5.214008287999689628e+00, 9.816326530612244916e-01, 3.077746534221364794e+00], 
-[5.214008287999689628e+00, 9.836734693877551283e-01, 3.440174492152117125e+00], 
-[5.214008287999689628e+00, 9.857142857142857650e-01, 3.901840486515340434e+00], 
-[5.214008287999689628e+00, 9.877551020408162907e-01, 4.510873729743489768e+00], 
-[5.214008287999689628e+00, 9.897959183673469274e-01, 5.352954714100849998e+00], 
-[5.214008287999689628e+00, 9.918367346938775642e-01, 6.597208858467697112e+00], 
-[5.214008287999689628e+00, 9.938775510204082009e-01, 8.631892883219641988e+00], 
-[5.214008287999689628e+00, 9.959183673469387266e-01, 1.259678557308986058e+01], 
-[5.214008287999689628e+00, 9.979591836734693633e-01, 2.399911836062943848e+01], 
-[5.214008287999689628e+00, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[5.722367659350219959e+00, 1.000000000000000021e-03, 4.192165930704204457e-02], 
-[5.722367659350219959e+00, 1.148922311909569708e-03, 4.187463305736843083e-02], 
-[5.722367659350219959e+00, 1.320022478803632065e-03, 4.182845564294232488e-02], 
-[5.722367659350219959e+00, 1.516603278119670137e-03, 4.178325368170408838e-02], 
-[5.722367659350219959e+00, 1.742459344546885402e-03, 4.173917290957340764e-02], 
-[5.722367659350219959e+00, 2.001950418545241171e-03, 4.169638114025600584e-02], 
-[5.722367659350219959e+00, 2.300085503203331758e-03, 4.165507170622156918e-02], 
-[5.722367659350219959e+00, 2.642619553930058204e-03, 4.161546746619262938e-02], 
-[5.722367659350219959e+00, 3.036164567398761706e-03, 4.157782548165281367e-02], 
-[5.722367659350219959e+00, 3.488317214113704091e-03, 4.154244248630389880e-02], 
-[5.722367659350219959e+00, 4.007805478313466660e-03, 4.150966129864581966e-02], 
-[5.722367659350219959e+00, 4.604657135827751671e-03, 4.147987836123612909e-02], 
-[5.722367659350219959e+00, 5.290393322046124149e-03, 4.145355263164322152e-02], 
-[5.722367659350219959e+00, 6.078250926476181683e-03, 4.143121610290551038e-02], 
-[5.722367659350219959e+00, 6.983438106813499684e-03, 4.141348629841947598e-02], 
-[5.722367659350219959e+00, 8.023427854757562983e-03, 4.140108117215433176e-02], 
-[5.722367659350219959e+00, 9.218295280327699903e-03, 4.139483695603592139e-02], 
-[5.722367659350219959e+00, 1.059110512533918171e-02, 4.139572964003299105e-02], 
-[5.722367659350219959e+00, 1.216835698628199354e-02, 4.140490095845317242e-02], 
-[5.722367659350219959e+00, 1.398049684082008047e-02, 4.142369000269337243e-02], 
-[5.722367659350219959e+00, 1.606250475199945058e-02, 4.145367190741208741e-02], 
-[5.722367659350219959e+00, 1.845457009472566828e-02, 4.149670549246024798e-02], 
-[5.722367659350219959e+00, 2.120286733852943389e-02, 4.155499232748542660e-02], 
-[5.722367659350219959e+00, 2.436044736169515681e-02, 4.163115047720677975e-02], 
-[5.722367659350219959e+00, 2.798826150195019707e-02, 4.172830726487693209e-02], 
-[5.722367659350219959e+00, 3.215633811115024138e-02, 4.185021687782497501e-02], 
-[5.722367659350219959e+00, 3.694513432520856594e-02, 4.200141070550549027e-02], 
-[5.722367659350219959e+00, 4.244708914272822542e-02, 4.218739120387066110e-02], 
-[5.722367659350219959e+00, 4.876840779169493850e-02, 4.241488420636877615e-02], 
-[5.722367659350219959e+00, 5.603111182818285713e-02, 4.269217054078656981e-02], 
-[5.722367659350219959e+00, 6.437539454049952259e-02, 4.302952647808509778e-02], 
-[5.722367659350219959e+00, 7.396232712556144451e-02, 4.343981538246602381e-02], 
-[5.722367659350219959e+00, 8.497696787531199003e-02, 4.393929228899423611e-02], 
-[5.722367659350219959e+00, 9.763193439036874088e-02, 4.454871286513115147e-02], 
-[5.722367659350219959e+00, 1.121715077759858903e-01, 4.529488484363144302e-02], 
-[5.722367659350219959e+00, 1.288763480443681220e-01, 4.621287489461138598e-02], 
-[5.722367659350219959e+00, 1.480689117455977755e-01, 4.734920736827448462e-02], 
-[5.722367659350219959e+00, 1.701196764046864207e-01, 4.876660108046280973e-02], 
-[5.722367659350219959e+00, 1.954542919161802172e-01, 5.055115893416660400e-02], 
-[5.722367659350219959e+00, 2.245617969409859638e-01, 5.282359874959501045e-02], 
-[5.722367659350219959e+00, 2.580040589080049296e-01, 5.575740123270492288e-02], 
-[5.722367659350219959e+00, 2.964266198426381838e-01, 5.960934549999650361e-02], 
-[5.722367659350219959e+00, 3.405711573811430193e-01, 6.477346849939621953e-02], 
-[5.722367659350219959e+00, 3.912898015080607528e-01, 7.188236425673219521e-02], 
-[5.722367659350219959e+00, 4.495615833752782953e-01, 8.201246766994083059e-02], 
-[5.722367659350219959e+00, 5.165113337172515529e-01, 9.714367947682026050e-02], 
-[5.722367659350219959e+00, 5.934313956619206021e-01, 1.213381715981600717e-01], 
-[5.722367659350219959e+00, 6.818065710636164178e-01, 1.644249131125237740e-01], 
-[5.722367659350219959e+00, 7.833427819015473803e-01, 2.579099751583354694e-01], 
-[5.722367659350219959e+00, 9.000000000000000222e-01, 5.916176411352738196e-01], 
-[5.722367659350219959e+00, 9.020408163265306589e-01, 6.042619459444356078e-01], 
-[5.722367659350219959e+00, 9.040816326530612956e-01, 6.174258989514624929e-01], 
-[5.722367659350219959e+00, 9.061224489795918213e-01, 6.311425048071572785e-01], 
-[5.722367659350219959e+00, 9.081632653061224580e-01, 6.454476443886933978e-01], 
-[5.722367659350219959e+00, 9.102040816326530948e-01, 6.603803964824868089e-01], 
-[5.722367659350219959e+00, 9.122448979591837315e-01, 6.759834037570999765e-01], 
-[5.722367659350219959e+00, 9.142857142857142572e-01, 6.923032903230301738e-01], 
-[5.722367659350219959e+00, 9.163265306122448939e-01, 7.093911395854239910e-01], 
-[5.722367659350219959e+00, 9.183673469387755306e-01, 7.273030428193258956e-01], 
-[5.722367659350219959e+00, 9.204081632653061673e-01, 7.461007310146281490e-01], 
-[5.722367659350219959e+00, 9.224489795918368040e-01, 7.658523051522506675e-01], 
-[5.722367659350219959e+00, 9.244897959183673297e-01, 7.866330833177989090e-01], 
-[5.722367659350219959e+00, 9.265306122448979664e-01, 8.085265871070184129e-01], 
-[5.722367659350219959e+00, 9.285714285714286031e-01, 8.316256948570306395e-01], 
-[5.722367659350219959e+00, 9.306122448979592399e-01, 8.560339956489225743e-01], 
-[5.722367659350219959e+00, 9.326530612244897656e-01, 8.818673861712105211e-01], 
-[5.722367659350219959e+00, 9.346938775510204023e-01, 9.092559629468068838e-01], 
-[5.722367659350219959e+00, 9.367346938775510390e-01, 9.383462758339258247e-01], 
-[5.722367659350219959e+00, 9.387755102040816757e-01, 9.693040261036897087e-01], 
-[5.722367659350219959e+00, 9.408163265306123124e-01, 1.002317315136172171e+00], 
-[5.722367659350219959e+00, 9.428571428571428381e-01, 1.037600579754871077e+00], 
-[5.722367659350219959e+00, 9.448979591836734748e-01, 1.075399390095968633e+00], 
-[5.722367659350219959e+00, 9.469387755102041115e-01, 1.115996339455347153e+00], 
-[5.722367659350219959e+00, 9.489795918367347483e-01, 1.159718328194912829e+00], 
-[5.722367659350219959e+00, 9.510204081632652739e-01, 1.206945643403454227e+00], 
-[5.722367659350219959e+00, 9.530612244897959107e-01, 1.258123374220903257e+00], 
-[5.722367659350219959e+00, 9.551020408163265474e-01, 1.313775896935898357e+00], 
-[5.722367659350219959e+00, 9.571428571428571841e-01, 1.374525440575064650e+00], 
-[5.722367659350219959e+00, 9.591836734693878208e-01, 1.441116143546403272e+00], 
-[5.722367659350219959e+00, 9.612244897959183465e-01, 1.514445599243439133e+00], 
-[5.722367659350219959e+00, 9.632653061224489832e-01, 1.595606766561001644e+00], 
-[5.722367659350219959e+00, 9.653061224489796199e-01, 1.685944459411069740e+00], 
-[5.722367659350219959e+00, 9.673469387755102566e-01, 1.787132712389252420e+00], 
-[5.722367659350219959e+00, 9.693877551020407823e-01, 1.901282639559324084e+00], 
-[5.722367659350219959e+00, 9.714285714285714191e-01, 2.031095834668091626e+00], 
-[5.722367659350219959e+00, 9.734693877551020558e-01, 2.180087512091467339e+00], 
-[5.722367659350219959e+00, 9.755102040816326925e-01, 2.352919526773517678e+00], 
-[5.722367659350219959e+00, 9.775510204081632182e-01, 2.555912245419491136e+00], 
-[5.722367659350219959e+00, 9.795918367346938549e-01, 2.797858728543541673e+00], 
-[5.722367659350219959e+00, 9.816326530612244916e-01, 3.091373016187549894e+00], 
-[5.722367659350219959e+00, 9.836734693877551283e-01, 3.455233035889249571e+00], 
-[5.722367659350219959e+00, 9.857142857142857650e-01, 3.918697732457201433e+00], 
-[5.722367659350219959e+00, 9.877551020408162907e-01, 4.530065375892625923e+00], 
-[5.722367659350219959e+00, 9.897959183673469274e-01, 5.375311826498720080e+00], 
-[5.722367659350219959e+00, 9.918367346938775642e-01, 6.624132421063840148e+00], 
-[5.722367659350219959e+00, 9.938775510204082009e-01, 8.666054943874065941e+00], 
-[5.722367659350219959e+00, 9.959183673469387266e-01, 1.264444377295085431e+01], 
-[5.722367659350219959e+00, 9.979591836734693633e-01, 2.408274621945315630e+01], 
-[5.722367659350219959e+00, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[6.280291441834259025e+00, 1.000000000000000021e-03, 4.219720638873592639e-02], 
-[6.280291441834259025e+00, 1.148922311909569708e-03, 4.214956271242140812e-02], 
-[6.280291441834259025e+00, 1.320022478803632065e-03, 4.210277292483094458e-02], 
-[6.280291441834259025e+00, 1.516603278119670137e-03, 4.205696439149116117e-02], 
-[6.280291441834259025e+00, 1.742459344546885402e-03, 4.201228370787678246e-02], 
-[6.280291441834259025e+00, 2.001950418545241171e-03, 4.196889967642143671e-02], 
-[6.280291441834259025e+00, 2.300085503203331758e-03, 4.192700676748058186e-02], 
-[6.280291441834259025e+00, 2.642619553930058204e-03, 4.188682915007579943e-02], 
-[6.280291441834259025e+00, 3.036164567398761706e-03, 4.184862539551964522e-02], 
-[6.280291441834259025e+00, 3.488317214113704091e-03, 4.181269397855773284e-02], 
-[6.280291441834259025e+00, 4.007805478313466660e-03, 4.177937972707285175e-02], 
-[6.280291441834259025e+00, 4.604657135827751671e-03, 4.174908140495370984e-02], 
-[6.280291441834259025e+00, 5.290393322046124149e-03, 4.172226065443741111e-02], 
-[6.280291441834259025e+00, 6.078250926476181683e-03, 4.169945257732915467e-02], 
-[6.280291441834259025e+00, 6.983438106813499684e-03, 4.168127830199772066e-02], 
-[6.280291441834259025e+00, 8.023427854757562983e-03, 4.166845996951142050e-02], 
-[6.280291441834259025e+00, 9.218295280327699903e-03, 4.166183868385041345e-02], 
-[6.280291441834259025e+00, 1.059110512533918171e-02, 4.166239611564800938e-02], 
-[6.280291441834259025e+00, 1.216835698628199354e-02, 4.167128063794291182e-02], 
-[6.280291441834259025e+00, 1.398049684082008047e-02, 4.168983912056659080e-02], 
-[6.280291441834259025e+00, 1.606250475199945058e-02, 4.171965583835410274e-02], 
-[6.280291441834259025e+00, 1.845457009472566828e-02, 4.176260038619139525e-02], 
-[6.280291441834259025e+00, 2.120286733852943389e-02, 4.182088708177507386e-02], 
-[6.280291441834259025e+00, 2.436044736169515681e-02, 4.189714913247886974e-02], 
-[6.280291441834259025e+00, 2.798826150195019707e-02, 4.199453192827504178e-02], 
-[6.280291441834259025e+00, 3.215633811115024138e-02, 4.211681131732147865e-02], 
-[6.280291441834259025e+00, 3.694513432520856594e-02, 4.226854479883638410e-02], 
-[6.280291441834259025e+00, 4.244708914272822542e-02, 4.245526648735528652e-02], 
-[6.280291441834259025e+00, 4.876840779169493850e-02, 4.268374085171723620e-02], 
-[6.280291441834259025e+00, 5.603111182818285713e-02, 4.296229620369444724e-02], 
-[6.280291441834259025e+00, 6.437539454049952259e-02, 4.330126762557350018e-02], 
-[6.280291441834259025e+00, 7.396232712556144451e-02, 4.371359193913031127e-02], 
-[6.280291441834259025e+00, 8.497696787531199003e-02, 4.421561678065603213e-02], 
-[6.280291441834259025e+00, 9.763193439036874088e-02, 4.482821573745365829e-02], 
-[6.280291441834259025e+00, 1.121715077759858903e-01, 4.557834838325007520e-02], 
-[6.280291441834259025e+00, 1.288763480443681220e-01, 4.650127933126660396e-02], 
-[6.280291441834259025e+00, 1.480689117455977755e-01, 4.764379454499861888e-02], 
-[6.280291441834259025e+00, 1.701196764046864207e-01, 4.906896399845342427e-02], 
-[6.280291441834259025e+00, 1.954542919161802172e-01, 5.086337033972565536e-02], 
-[6.280291441834259025e+00, 2.245617969409859638e-01, 5.314840031612557553e-02], 
-[6.280291441834259025e+00, 2.580040589080049296e-01, 5.609848996885651029e-02], 
-[6.280291441834259025e+00, 2.964266198426381838e-01, 5.997182248050591385e-02], 
-[6.280291441834259025e+00, 3.405711573811430193e-01, 6.516457197133565526e-02], 
-[6.280291441834259025e+00, 3.912898015080607528e-01, 7.231273147550312808e-02], 
-[6.280291441834259025e+00, 4.495615833752782953e-01, 8.249845652217213665e-02], 
-[6.280291441834259025e+00, 5.165113337172515529e-01, 9.771203299684080856e-02], 
-[6.280291441834259025e+00, 5.934313956619206021e-01, 1.220366009900490656e-01], 
-[6.280291441834259025e+00, 6.818065710636164178e-01, 1.653508322328174629e-01], 
-[6.280291441834259025e+00, 7.833427819015473803e-01, 2.593156008809772706e-01], 
-[6.280291441834259025e+00, 9.000000000000000222e-01, 5.946417472830993756e-01], 
-[6.280291441834259025e+00, 9.020408163265306589e-01, 6.073453636920926879e-01], 
-[6.280291441834259025e+00, 9.040816326530612956e-01, 6.205709419915543812e-01], 
-[6.280291441834259025e+00, 9.061224489795918213e-01, 6.343516285731075621e-01], 
-[6.280291441834259025e+00, 9.081632653061224580e-01, 6.487234580687553098e-01], 
-[6.280291441834259025e+00, 9.102040816326530948e-01, 6.637256763470937848e-01], 
-[6.280291441834259025e+00, 9.122448979591837315e-01, 6.794011079768805805e-01], 
-[6.280291441834259025e+00, 9.142857142857142572e-01, 6.957965754835382377e-01], 
-[6.280291441834259025e+00, 9.163265306122448939e-01, 7.129633791387597341e-01], 
-[6.280291441834259025e+00, 9.183673469387755306e-01, 7.309578477537572727e-01], 
-[6.280291441834259025e+00, 9.204081632653061673e-01, 7.498419730722236665e-01], 
-[6.280291441834259025e+00, 9.224489795918368040e-01, 7.696841429836500659e-01], 
-[6.280291441834259025e+00, 9.244897959183673297e-01, 7.905599920347173848e-01], 
-[6.280291441834259025e+00, 9.265306122448979664e-01, 8.125533917800573658e-01], 
-[6.280291441834259025e+00, 9.285714285714286031e-01, 8.357576086126987658e-01], 
-[6.280291441834259025e+00, 9.306122448979592399e-01, 8.602766631504747963e-01], 
-[6.280291441834259025e+00, 9.326530612244897656e-01, 8.862269334294686773e-01], 
-[6.280291441834259025e+00, 9.346938775510204023e-01, 9.137390546080177423e-01], 
-[6.280291441834259025e+00, 9.367346938775510390e-01, 9.429601813430656954e-01], 
-[6.280291441834259025e+00, 9.387755102040816757e-01, 9.740566964582364484e-01], 
-[6.280291441834259025e+00, 9.408163265306123124e-01, 1.007217472346984444e+00], 
-[6.280291441834259025e+00, 9.428571428571428381e-01, 1.042657821644093152e+00], 
-[6.280291441834259025e+00, 9.448979591836734748e-01, 1.080624313723140828e+00], 
-[6.280291441834259025e+00, 9.469387755102041115e-01, 1.121400687322085199e+00], 
-[6.280291441834259025e+00, 9.489795918367347483e-01, 1.165315162505112578e+00], 
-[6.280291441834259025e+00, 9.510204081632652739e-01, 1.212749555147742964e+00], 
-[6.280291441834259025e+00, 9.530612244897959107e-01, 1.264150735850259277e+00], 
-[6.280291441834259025e+00, 9.551020408163265474e-01, 1.320045170091089126e+00], 
-[6.280291441834259025e+00, 9.571428571428571841e-01, 1.381057554040374225e+00], 
-[6.280291441834259025e+00, 9.591836734693878208e-01, 1.447934961736343507e+00], 
-[6.280291441834259025e+00, 9.612244897959183465e-01, 1.521578508773111293e+00], 
-[6.280291441834259025e+00, 9.632653061224489832e-01, 1.603085418817359109e+00], 
-[6.280291441834259025e+00, 9.653061224489796199e-01, 1.693805722142903258e+00], 
-[6.280291441834259025e+00, 9.673469387755102566e-01, 1.795419905758058210e+00], 
-[6.280291441834259025e+00, 9.693877551020407823e-01, 1.910047166112922135e+00], 
-[6.280291441834259025e+00, 9.714285714285714191e-01, 2.040399365556348599e+00], 
-[6.280291441834259025e+00, 9.734693877551020558e-01, 2.190004976202365228e+00], 
-[6.280291441834259025e+00, 9.755102040816326925e-01, 2.363543288254196462e+00], 
-[6.280291441834259025e+00, 9.775510204081632182e-01, 2.567358091439420953e+00], 
-[6.280291441834259025e+00, 9.795918367346938549e-01, 2.810274708254798082e+00], 
-[6.280291441834259025e+00, 9.816326530612244916e-01, 3.104952950440329928e+00], 
-[6.280291441834259025e+00, 9.836734693877551283e-01, 3.470238046221977513e+00], 
-[6.280291441834259025e+00, 9.857142857142857650e-01, 3.935492347982620487e+00], 
-[6.280291441834259025e+00, 9.877551020408162907e-01, 4.549182095689894290e+00], 
-[6.280291441834259025e+00, 9.897959183673469274e-01, 5.397576542985874859e+00], 
-[6.280291441834259025e+00, 9.918367346938775642e-01, 6.650936958240805552e+00], 
-[6.280291441834259025e+00, 9.938775510204082009e-01, 8.700052793460240963e+00], 
-[6.280291441834259025e+00, 9.959183673469387266e-01, 1.269184551228815749e+01], 
-[6.280291441834259025e+00, 9.979591836734693633e-01, 2.416583391583598583e+01], 
-[6.280291441834259025e+00, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[6.892612104349701951e+00, 1.000000000000000021e-03, 4.247312005602003893e-02], 
-[6.892612104349701951e+00, 1.148922311909569708e-03, 4.242485457389069681e-02], 
-[6.892612104349701951e+00, 1.320022478803632065e-03, 4.237744803448929148e-02], 
-[6.892612104349701951e+00, 1.516603278119670137e-03, 4.233102855093827388e-02], 
-[6.892612104349701951e+00, 1.742459344546885402e-03, 4.228574357826823948e-02], 
-[6.892612104349701951e+00, 2.001950418545241171e-03, 4.224176290763004271e-02], 
-[6.892612104349701951e+00, 2.300085503203331758e-03, 4.219928214723948912e-02], 
-[6.892612104349701951e+00, 2.642619553930058204e-03, 4.215852677637252355e-02], 
-[6.892612104349701951e+00, 3.036164567398761706e-03, 4.211975687610181041e-02], 
-[6.892612104349701951e+00, 3.488317214113704091e-03, 4.208327266211737278e-02], 
-[6.892612104349701951e+00, 4.007805478313466660e-03, 4.204942097154720781e-02], 
-[6.892612104349701951e+00, 4.604657135827751671e-03, 4.201860288942571575e-02], 
-[6.892612104349701951e+00, 5.290393322046124149e-03, 4.199128274241391290e-02], 
-[6.892612104349701951e+00, 6.078250926476181683e-03, 4.196799874076542758e-02], 
-[6.892612104349701951e+00, 6.983438106813499684e-03, 4.194937561741191034e-02], 
-[6.892612104349701951e+00, 8.023427854757562983e-03, 4.193613969999850088e-02], 
-[6.892612104349701951e+00, 9.218295280327699903e-03, 4.192913696389793943e-02], 
-[6.892612104349701951e+00, 1.059110512533918171e-02, 4.192935475957321190e-02], 
-[6.892612104349701951e+00, 1.216835698628199354e-02, 4.193794809774423205e-02], 
-[6.892612104349701951e+00, 1.398049684082008047e-02, 4.195627162535894850e-02], 
-[6.892612104349701951e+00, 1.606250475199945058e-02, 4.198591875577539767e-02], 
-[6.892612104349701951e+00, 1.845457009472566828e-02, 4.202876985683860755e-02], 
-[6.892612104349701951e+00, 2.120286733852943389e-02, 4.208705199168370770e-02], 
-[6.892612104349701951e+00, 2.436044736169515681e-02, 4.216341350704708169e-02], 
-[6.892612104349701951e+00, 2.798826150195019707e-02, 4.226101785545319234e-02], 
-[6.892612104349701951e+00, 3.215633811115024138e-02, 4.238366254058641841e-02], 
-[6.892612104349701951e+00, 3.694513432520856594e-02, 4.253593116464167434e-02], 
-[6.892612104349701951e+00, 4.244708914272822542e-02, 4.272338949198799252e-02], 
-[6.892612104349701951e+00, 4.876840779169493850e-02, 4.295284061548235860e-02], 
-[6.892612104349701951e+00, 5.603111182818285713e-02, 4.323266031596360859e-02], 
-[6.892612104349701951e+00, 6.437539454049952259e-02, 4.357324246727233702e-02], 
-[6.892612104349701951e+00, 7.396232712556144451e-02, 4.398759732226223407e-02], 
-[6.892612104349701951e+00, 8.497696787531199003e-02, 4.449216508250782715e-02], 
-[6.892612104349701951e+00, 9.763193439036874088e-02, 4.510793720575265869e-02], 
-[6.892612104349701951e+00, 1.121715077759858903e-01, 4.586202503782807471e-02], 
-[6.892612104349701951e+00, 1.288763480443681220e-01, 4.678989103756932277e-02], 
-[6.892612104349701951e+00, 1.480689117455977755e-01, 4.793858264142258213e-02], 
-[6.892612104349701951e+00, 1.701196764046864207e-01, 4.937152077577579290e-02], 
-[6.892612104349701951e+00, 1.954542919161802172e-01, 5.117576752580318966e-02], 
-[6.892612104349701951e+00, 2.245617969409859638e-01, 5.347337809394418773e-02], 
-[6.892612104349701951e+00, 2.580040589080049296e-01, 5.643974311361709545e-02], 
-[6.892612104349701951e+00, 2.964266198426381838e-01, 6.033444862565016248e-02], 
-[6.892612104349701951e+00, 3.405711573811430193e-01, 6.555580388148543602e-02], 
-[6.892612104349701951e+00, 3.912898015080607528e-01, 7.274319730344577795e-02], 
-[6.892612104349701951e+00, 4.495615833752782953e-01, 8.298449822006165322e-02], 
-[6.892612104349701951e+00, 5.165113337172515529e-01, 9.828036365782627515e-02], 
-[6.892612104349701951e+00, 5.934313956619206021e-01, 1.227348696163880482e-01], 
-[6.892612104349701951e+00, 6.818065710636164178e-01, 1.662763018782371094e-01], 
-[6.892612104349701951e+00, 7.833427819015473803e-01, 2.607200086646581649e-01], 
-[6.892612104349701951e+00, 9.000000000000000222e-01, 5.976609655239131236e-01], 
-[6.892612104349701951e+00, 9.020408163265306589e-01, 6.104237352537100758e-01], 
-[6.892612104349701951e+00, 9.040816326530612956e-01, 6.237107729067046247e-01], 
-[6.892612104349701951e+00, 9.061224489795918213e-01, 6.375553660827077973e-01], 
-[6.892612104349701951e+00, 9.081632653061224580e-01, 6.519937025866182623e-01], 
-[6.892612104349701951e+00, 9.102040816326530948e-01, 6.670651947322139286e-01], 
-[6.892612104349701951e+00, 9.122448979591837315e-01, 6.828128482897954932e-01], 
-[6.892612104349701951e+00, 9.142857142857142572e-01, 6.992836834318459927e-01], 
-[6.892612104349701951e+00, 9.163265306122448939e-01, 7.165292164508767492e-01], 
-[6.892612104349701951e+00, 9.183673469387755306e-01, 7.346060127606395262e-01], 
-[6.892612104349701951e+00, 9.204081632653061673e-01, 7.535763238255372976e-01], 
-[6.892612104349701951e+00, 9.224489795918368040e-01, 7.735088232976277123e-01], 
-[6.892612104349701951e+00, 9.244897959183673297e-01, 7.944794609100814808e-01], 
-[6.892612104349701951e+00, 9.265306122448979664e-01, 8.165724567549099699e-01], 
-[6.892612104349701951e+00, 9.285714285714286031e-01, 8.398814636910807430e-01], 
-[6.892612104349701951e+00, 9.306122448979592399e-01, 8.645109320893199500e-01], 
-[6.892612104349701951e+00, 9.326530612244897656e-01, 8.905777193254085233e-01], 
-[6.892612104349701951e+00, 9.346938775510204023e-01, 9.182129969253245427e-01], 
-[6.892612104349701951e+00, 9.367346938775510390e-01, 9.475645217740680248e-01], 
-[6.892612104349701951e+00, 9.387755102040816757e-01, 9.787993553224665355e-01], 
-[6.892612104349701951e+00, 9.408163265306123124e-01, 1.012107137634791654e+00], 
-[6.892612104349701951e+00, 9.428571428571428381e-01, 1.047704053320970496e+00], 
-[6.892612104349701951e+00, 9.448979591836734748e-01, 1.085837666568673088e+00], 
-[6.892612104349701951e+00, 9.469387755102041115e-01, 1.126792856431898304e+00], 
-[6.892612104349701951e+00, 9.489795918367347483e-01, 1.170899156704549693e+00], 
-[6.892612104349701951e+00, 9.510204081632652739e-01, 1.218539905049407457e+00], 
-[6.892612104349701951e+00, 9.530612244897959107e-01, 1.270163745272477218e+00], 
-[6.892612104349701951e+00, 9.551020408163265474e-01, 1.326299222240629572e+00], 
-[6.892612104349701951e+00, 9.571428571428571841e-01, 1.387573487543209305e+00], 
-[6.892612104349701951e+00, 9.591836734693878208e-01, 1.454736536710397043e+00], 
-[6.892612104349701951e+00, 9.612244897959183465e-01, 1.528692990336111723e+00], 
-[6.892612104349701951e+00, 9.632653061224489832e-01, 1.610544315727427067e+00], 
-[6.892612104349701951e+00, 9.653061224489796199e-01, 1.701645733278497552e+00], 
-[6.892612104349701951e+00, 9.673469387755102566e-01, 1.803684149430425432e+00], 
-[6.892612104349701951e+00, 9.693877551020407823e-01, 1.918786801011797882e+00], 
-[6.892612104349701951e+00, 9.714285714285714191e-01, 2.049675764652637344e+00], 
-[6.892612104349701951e+00, 9.734693877551020558e-01, 2.199892698748089792e+00], 
-[6.892612104349701951e+00, 9.755102040816326925e-01, 2.374134232898956309e+00], 
-[6.892612104349701951e+00, 9.775510204081632182e-01, 2.578767448301674037e+00], 
-[6.892612104349701951e+00, 9.795918367346938549e-01, 2.822649744040174546e+00], 
-[6.892612104349701951e+00, 9.816326530612244916e-01, 3.118486433907949440e+00], 
-[6.892612104349701951e+00, 9.836734693877551283e-01, 3.485189639424898012e+00], 
-[6.892612104349701951e+00, 9.857142857142857650e-01, 3.952224475484607424e+00], 
-[6.892612104349701951e+00, 9.877551020408162907e-01, 4.568224068263182502e+00], 
-[6.892612104349701951e+00, 9.897959183673469274e-01, 5.419749097265533777e+00], 
-[6.892612104349701951e+00, 9.918367346938775642e-01, 6.677622791287466164e+00], 
-[6.892612104349701951e+00, 9.938775510204082009e-01, 8.733886911341986803e+00], 
-[6.892612104349701951e+00, 9.959183673469387266e-01, 1.273899161975440819e+01], 
-[6.892612104349701951e+00, 9.979591836734693633e-01, 2.424838348716696856e+01], 
-[6.892612104349701951e+00, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[7.564633275546290392e+00, 1.000000000000000021e-03, 4.274940055759413049e-02], 
-[7.564633275546290392e+00, 1.148922311909569708e-03, 4.270050888340651274e-02], 
-[7.564633275546290392e+00, 1.320022478803632065e-03, 4.265248120646948637e-02], 
-[7.564633275546290392e+00, 1.516603278119670137e-03, 4.260544638750972390e-02], 
-[7.564633275546290392e+00, 1.742459344546885402e-03, 4.255955274111307418e-02], 
-[7.564633275546290392e+00, 2.001950418545241171e-03, 4.251497104713547470e-02], 
-[7.564633275546290392e+00, 2.300085503203331758e-03, 4.247189805162566306e-02], 
-[7.564633275546290392e+00, 2.642619553930058204e-03, 4.243056054406735972e-02], 
-[7.564633275546290392e+00, 3.036164567398761706e-03, 4.239122011522201972e-02], 
-[7.564633275546290392e+00, 3.488317214113704091e-03, 4.235417872162201836e-02], 
-[7.564633275546290392e+00, 4.007805478313466660e-03, 4.231978520949963851e-02], 
-[7.564633275546290392e+00, 4.604657135827751671e-03, 4.228844298484603359e-02], 
-[7.564633275546290392e+00, 5.290393322046124149e-03, 4.226061905849717165e-02], 
-[7.564633275546290392e+00, 6.078250926476181683e-03, 4.223685474883194513e-02], 
-[7.564633275546290392e+00, 6.983438106813499684e-03, 4.221777839292998463e-02], 
-[7.564633275546290392e+00, 8.023427854757562983e-03, 4.220412050448465319e-02], 
-[7.564633275546290392e+00, 9.218295280327699903e-03, 4.219673192959220998e-02], 
-[7.564633275546290392e+00, 1.059110512533918171e-02, 4.219660569770194991e-02], 
-[7.564633275546290392e+00, 1.216835698628199354e-02, 4.220490345615524053e-02], 
-[7.564633275546290392e+00, 1.398049684082008047e-02, 4.222298762768704472e-02], 
-[7.564633275546290392e+00, 1.606250475199945058e-02, 4.225246076251132354e-02], 
-[7.564633275546290392e+00, 1.845457009472566828e-02, 4.229521399934071946e-02], 
-[7.564633275546290392e+00, 2.120286733852943389e-02, 4.235348714411997506e-02], 
-[7.564633275546290392e+00, 2.436044736169515681e-02, 4.242994367963465185e-02], 
-[7.564633275546290392e+00, 2.798826150195019707e-02, 4.252776511676836790e-02], 
-[7.564633275546290392e+00, 3.215633811115024138e-02, 4.265077060939956310e-02], 
-[7.564633275546290392e+00, 3.694513432520856594e-02, 4.280356985587673024e-02], 
-[7.564633275546290392e+00, 4.244708914272822542e-02, 4.299176026160950181e-02], 
-[7.564633275546290392e+00, 4.876840779169493850e-02, 4.322218353204804187e-02], 
-[7.564633275546290392e+00, 5.603111182818285713e-02, 4.350326290211597308e-02], 
-[7.564633275546290392e+00, 6.437539454049952259e-02, 4.384545101736007922e-02], 
-[7.564633275546290392e+00, 7.396232712556144451e-02, 4.426183153512164292e-02], 
-[7.564633275546290392e+00, 8.497696787531199003e-02, 4.476893718620036933e-02], 
-[7.564633275546290392e+00, 9.763193439036874088e-02, 4.538787724923625672e-02], 
-[7.564633275546290392e+00, 1.121715077759858903e-01, 4.614591477311835721e-02], 
-[7.564633275546290392e+00, 1.288763480443681220e-01, 4.707870996457944046e-02], 
-[7.564633275546290392e+00, 1.480689117455977755e-01, 4.823357159238968878e-02], 
-[7.564633275546290392e+00, 1.701196764046864207e-01, 4.967427132916756721e-02], 
-[7.564633275546290392e+00, 1.954542919161802172e-01, 5.148835038867229791e-02], 
-[7.564633275546290392e+00, 2.245617969409859638e-01, 5.379853195588747000e-02], 
-[7.564633275546290392e+00, 2.580040589080049296e-01, 5.678116051262467601e-02], 
-[7.564633275546290392e+00, 2.964266198426381838e-01, 6.069722374907700335e-02], 
-[7.564633275546290392e+00, 3.405711573811430193e-01, 6.594716400540087675e-02], 
-[7.564633275546290392e+00, 3.912898015080607528e-01, 7.317376147034150569e-02], 
-[7.564633275546290392e+00, 4.495615833752782953e-01, 8.347059243836471576e-02], 
-[7.564633275546290392e+00, 5.165113337172515529e-01, 9.884867107001099606e-02], 
-[7.564633275546290392e+00, 5.934313956619206021e-01, 1.234329770201763321e-01], 
-[7.564633275546290392e+00, 6.818065710636164178e-01, 1.672013215633025851e-01], 
-[7.564633275546290392e+00, 7.833427819015473803e-01, 2.621231982941047978e-01], 
-[7.564633275546290392e+00, 9.000000000000000222e-01, 6.006752993583068800e-01], 
-[7.564633275546290392e+00, 9.020408163265306589e-01, 6.134970643390391665e-01], 
-[7.564633275546290392e+00, 9.040816326530612956e-01, 6.268453956290173101e-01], 
-[7.564633275546290392e+00, 9.061224489795918213e-01, 6.407537215046720247e-01], 
-[7.564633275546290392e+00, 9.081632653061224580e-01, 6.552583823630391269e-01], 
-[7.564633275546290392e+00, 9.102040816326530948e-01, 6.703989563273755614e-01], 
-[7.564633275546290392e+00, 9.122448979591837315e-01, 6.862186296723076229e-01], 
-[7.564633275546290392e+00, 9.142857142857142572e-01, 7.027646194511150135e-01], 
-[7.564633275546290392e+00, 9.163265306122448939e-01, 7.200886571331607255e-01], 
-[7.564633275546290392e+00, 9.183673469387755306e-01, 7.382475438030851045e-01], 
-[7.564633275546290392e+00, 9.204081632653061673e-01, 7.573037896151141313e-01], 
-[7.564633275546290392e+00, 9.224489795918368040e-01, 7.773263528403400180e-01], 
-[7.564633275546290392e+00, 9.244897959183673297e-01, 7.983914971266090621e-01], 
-[7.564633275546290392e+00, 9.265306122448979664e-01, 8.205837896849326185e-01], 
-[7.564633275546290392e+00, 9.285714285714286031e-01, 8.439972682537788540e-01], 
-[7.564633275546290392e+00, 9.306122448979592399e-01, 8.687368111769189216e-01], 
-[7.564633275546290392e+00, 9.326530612244897656e-01, 8.949197531665131766e-01], 
-[7.564633275546290392e+00, 9.346938775510204023e-01, 9.226777998535973246e-01], 
-[7.564633275546290392e+00, 9.367346938775510390e-01, 9.521593077865121435e-01], 
-[7.564633275546290392e+00, 9.387755102040816757e-01, 9.835320141248479198e-01], 
-[7.564633275546290392e+00, 9.408163265306123124e-01, 1.016986323269052805e+00], 
-[7.564633275546290392e+00, 9.428571428571428381e-01, 1.052739287977253690e+00], 
-[7.564633275546290392e+00, 9.448979591836734748e-01, 1.091039462838643503e+00], 
-[7.564633275546290392e+00, 9.469387755102041115e-01, 1.132172862109817491e+00], 
-[7.564633275546290392e+00, 9.489795918367347483e-01, 1.176470327356688550e+00], 
-[7.564633275546290392e+00, 9.510204081632652739e-01, 1.224316711047454431e+00], 
-[7.564633275546290392e+00, 9.530612244897959107e-01, 1.276162421960276960e+00], 
-[7.564633275546290392e+00, 9.551020408163265474e-01, 1.332538074574474818e+00], 
-[7.564633275546290392e+00, 9.571428571428571841e-01, 1.394073264205023088e+00], 
-[7.564633275546290392e+00, 9.591836734693878208e-01, 1.461520893773379015e+00], 
-[7.564633275546290392e+00, 9.612244897959183465e-01, 1.535789071718906218e+00], 
-[7.564633275546290392e+00, 9.632653061224489832e-01, 1.617983487915510610e+00], 
-[7.564633275546290392e+00, 9.653061224489796199e-01, 1.709464526709235210e+00], 
-[7.564633275546290392e+00, 9.673469387755102566e-01, 1.811925481087368617e+00], 
-[7.564633275546290392e+00, 9.693877551020407823e-01, 1.927501586370042652e+00], 
-[7.564633275546290392e+00, 9.714285714285714191e-01, 2.058925079306721972e+00], 
-[7.564633275546290392e+00, 9.734693877551020558e-01, 2.209750733329955530e+00], 
-[7.564633275546290392e+00, 9.755102040816326925e-01, 2.384692421868351175e+00], 
-[7.564633275546290392e+00, 9.775510204081632182e-01, 2.590140386442582709e+00], 
-[7.564633275546290392e+00, 9.795918367346938549e-01, 2.834983917917353935e+00], 
-[7.564633275546290392e+00, 9.816326530612244916e-01, 3.131973563372243419e+00], 
-[7.564633275546290392e+00, 9.836734693877551283e-01, 3.500087931586310042e+00], 
-[7.564633275546290392e+00, 9.857142857142857650e-01, 3.968894257113487534e+00], 
-[7.564633275546290392e+00, 9.877551020408162907e-01, 4.587191472414470894e+00], 
-[7.564633275546290392e+00, 9.897959183673469274e-01, 5.441829722584529350e+00], 
-[7.564633275546290392e+00, 9.918367346938775642e-01, 6.704190240813753476e+00], 
-[7.564633275546290392e+00, 9.938775510204082009e-01, 8.767557775773042295e+00], 
-[7.564633275546290392e+00, 9.959183673469387266e-01, 1.278588292185095199e+01], 
-[7.564633275546290392e+00, 9.979591836734693633e-01, 2.433039696458831713e+01], 
-[7.564633275546290392e+00, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[8.302175681319752698e+00, 1.000000000000000021e-03, 4.302604814222825425e-02], 
-[8.302175681319752698e+00, 1.148922311909569708e-03, 4.297652588266520635e-02], 
-[8.302175681319752698e+00, 1.320022478803632065e-03, 4.292787267538575313e-02], 
-[8.302175681319752698e+00, 1.516603278119670137e-03, 4.288021812872779004e-02], 
-[8.302175681319752698e+00, 1.742459344546885402e-03, 4.283371141683054578e-02], 
-[8.302175681319752698e+00, 2.001950418545241171e-03, 4.278852430824119091e-02], 
-[8.302175681319752698e+00, 2.300085503203331758e-03, 4.274485468681230027e-02], 
-[8.302175681319752698e+00, 2.642619553930058204e-03, 4.270293065218654788e-02], 
-[8.302175681319752698e+00, 3.036164567398761706e-03, 4.266301530474060633e-02], 
-[8.302175681319752698e+00, 3.488317214113704091e-03, 4.262541234174433563e-02], 
-[8.302175681319752698e+00, 4.007805478313466660e-03, 4.259047261839035703e-02], 
-[8.302175681319752698e+00, 4.604657135827751671e-03, 4.255860186143391177e-02], 
-[8.302175681319752698e+00, 5.290393322046124149e-03, 4.253026976563285821e-02], 
-[8.302175681319752698e+00, 6.078250926476181683e-03, 4.250602075716352485e-02], 
-[8.302175681319752698e+00, 6.983438106813499684e-03, 4.248648677683300456e-02], 
-[8.302175681319752698e+00, 8.023427854757562983e-03, 4.247240252384808235e-02], 
-[8.302175681319752698e+00, 9.218295280327699903e-03, 4.246462371435202887e-02], 
-[8.302175681319752698e+00, 1.059110512533918171e-02, 4.246414905592863637e-02], 
-[8.302175681319752698e+00, 1.216835698628199354e-02, 4.247214683147113035e-02], 
-[8.302175681319752698e+00, 1.398049684082008047e-02, 4.248998723816053980e-02], 
-[8.302175681319752698e+00, 1.606250475199945058e-02, 4.251928196138646254e-02], 
-[8.302175681319752698e+00, 1.845457009472566828e-02, 4.256193290862186895e-02], 
-[8.302175681319752698e+00, 2.120286733852943389e-02, 4.262019262597399605e-02], 
-[8.302175681319752698e+00, 2.436044736169515681e-02, 4.269673972894243164e-02], 
-[8.302175681319752698e+00, 2.798826150195019707e-02, 4.279477378255150399e-02], 
-[8.302175681319752698e+00, 3.215633811115024138e-02, 4.291813558551094837e-02], 
-[8.302175681319752698e+00, 3.694513432520856594e-02, 4.307146092546374622e-02], 
-[8.302175681319752698e+00, 4.244708914272822542e-02, 4.326037884002402467e-02], 
-[8.302175681319752698e+00, 4.876840779169493850e-02, 4.349176963575843158e-02], 
-[8.302175681319752698e+00, 5.603111182818285713e-02, 4.377410398663084123e-02], 
-[8.302175681319752698e+00, 6.437539454049952259e-02, 4.411789328996994913e-02], 
-[8.302175681319752698e+00, 7.396232712556144451e-02, 4.453629458092094040e-02], 
-[8.302175681319752698e+00, 8.497696787531199003e-02, 4.504593308333527946e-02], 
-[8.302175681319752698e+00, 9.763193439036874088e-02, 4.566803584706226327e-02], 
-[8.302175681319752698e+00, 1.121715077759858903e-01, 4.643001755482330239e-02], 
-[8.302175681319752698e+00, 1.288763480443681220e-01, 4.736773606330733216e-02], 
-[8.302175681319752698e+00, 1.480689117455977755e-01, 4.852876133269623526e-02], 
-[8.302175681319752698e+00, 1.701196764046864207e-01, 4.997721557532389808e-02], 
-[8.302175681319752698e+00, 1.954542919161802172e-01, 5.180111882456796268e-02], 
-[8.302175681319752698e+00, 2.245617969409859638e-01, 5.412386177476852245e-02], 
-[8.302175681319752698e+00, 2.580040589080049296e-01, 5.712274201151106012e-02], 
-[8.302175681319752698e+00, 2.964266198426381838e-01, 6.106014766445387598e-02], 
-[8.302175681319752698e+00, 3.405711573811430193e-01, 6.633865211869553746e-02], 
-[8.302175681319752698e+00, 3.912898015080607528e-01, 7.360442370608856477e-02], 
-[8.302175681319752698e+00, 4.495615833752782953e-01, 8.395673885204470166e-02], 
-[8.302175681319752698e+00, 5.165113337172515529e-01, 9.941695484398416216e-02], 
-[8.302175681319752698e+00, 5.934313956619206021e-01, 1.241309227450165253e-01], 
-[8.302175681319752698e+00, 6.818065710636164178e-01, 1.681258908035874744e-01], 
-[8.302175681319752698e+00, 7.833427819015473803e-01, 2.635251695559603924e-01], 
-[8.302175681319752698e+00, 9.000000000000000222e-01, 6.036847522890588236e-01], 
-[8.302175681319752698e+00, 9.020408163265306589e-01, 6.165653546599272339e-01], 
-[8.302175681319752698e+00, 9.040816326530612956e-01, 6.299748140925879314e-01], 
-[8.302175681319752698e+00, 9.061224489795918213e-01, 6.439466990095896737e-01], 
-[8.302175681319752698e+00, 9.081632653061224580e-01, 6.585175018205190467e-01], 
-[8.302175681319752698e+00, 9.102040816326530948e-01, 6.737269658236987313e-01], 
-[8.302175681319752698e+00, 9.122448979591837315e-01, 6.896184571023151744e-01], 
-[8.302175681319752698e+00, 9.142857142857142572e-01, 7.062393888257532115e-01], 
-[8.302175681319752698e+00, 9.163265306122448939e-01, 7.236417067980356332e-01], 
-[8.302175681319752698e+00, 9.183673469387755306e-01, 7.418824468450120335e-01], 
-[8.302175681319752698e+00, 9.204081632653061673e-01, 7.610243767820459304e-01], 
-[8.302175681319752698e+00, 9.224489795918368040e-01, 7.811367383581964141e-01], 
-[8.302175681319752698e+00, 9.244897959183673297e-01, 8.022961078669443857e-01], 
-[8.302175681319752698e+00, 9.265306122448979664e-01, 8.245873982230403909e-01], 
-[8.302175681319752698e+00, 9.285714285714286031e-01, 8.481050304615426194e-01], 
-[8.302175681319752698e+00, 9.306122448979592399e-01, 8.729543091234149843e-01], 
-[8.302175681319752698e+00, 9.326530612244897656e-01, 8.992530442584294459e-01], 
-[8.302175681319752698e+00, 9.346938775510204023e-01, 9.271334733452845089e-01], 
-[8.302175681319752698e+00, 9.367346938775510390e-01, 9.567445500368969569e-01], 
-[8.302175681319752698e+00, 9.387755102040816757e-01, 9.882546842900223893e-01], 
-[8.302175681319752698e+00, 9.408163265306123124e-01, 1.021855041514556195e+00], 
-[8.302175681319752698e+00, 9.428571428571428381e-01, 1.057763538799066483e+00], 
-[8.302175681319752698e+00, 9.448979591836734748e-01, 1.096229716732414428e+00], 
-[8.302175681319752698e+00, 9.469387755102041115e-01, 1.137540719672919920e+00], 
-[8.302175681319752698e+00, 9.489795918367347483e-01, 1.182028691015620803e+00], 
-[8.302175681319752698e+00, 9.510204081632652739e-01, 1.230079991069890077e+00], 
-[8.302175681319752698e+00, 9.530612244897959107e-01, 1.282146785373508013e+00], 
-[8.302175681319752698e+00, 9.551020408163265474e-01, 1.338761748267544238e+00], 
-[8.302175681319752698e+00, 9.571428571428571841e-01, 1.400556907129717255e+00], 
-[8.302175681319752698e+00, 9.591836734693878208e-01, 1.468288058209618940e+00], 
-[8.302175681319752698e+00, 9.612244897959183465e-01, 1.542866780684029049e+00], 
-[8.302175681319752698e+00, 9.632653061224489832e-01, 1.625402965977915670e+00], 
-[8.302175681319752698e+00, 9.653061224489796199e-01, 1.717262136293658648e+00], 
-[8.302175681319752698e+00, 9.673469387755102566e-01, 1.820143938371250547e+00], 
-[8.302175681319752698e+00, 9.693877551020407823e-01, 1.936191564256080078e+00], 
-[8.302175681319752698e+00, 9.714285714285714191e-01, 2.068147356814113103e+00], 
-[8.302175681319752698e+00, 9.734693877551020558e-01, 2.219579133484408828e+00], 
-[8.302175681319752698e+00, 9.755102040816326925e-01, 2.395217916244757106e+00], 
-[8.302175681319752698e+00, 9.775510204081632182e-01, 2.601476976203341174e+00], 
-[8.302175681319752698e+00, 9.795918367346938549e-01, 2.847277311786905685e+00], 
-[8.302175681319752698e+00, 9.816326530612244916e-01, 3.145414435468727454e+00], 
-[8.302175681319752698e+00, 9.836734693877551283e-01, 3.514933038608373472e+00], 
-[8.302175681319752698e+00, 9.857142857142857650e-01, 3.985501834777204433e+00], 
-[8.302175681319752698e+00, 9.877551020408162907e-01, 4.606084486620249052e+00], 
-[8.302175681319752698e+00, 9.897959183673469274e-01, 5.463818651733905796e+00], 
-[8.302175681319752698e+00, 9.918367346938775642e-01, 6.730639626751745652e+00], 
-[8.302175681319752698e+00, 9.938775510204082009e-01, 8.801065863899072639e+00], 
-[8.302175681319752698e+00, 9.959183673469387266e-01, 1.283252024293274118e+01], 
-[8.302175681319752698e+00, 9.979591836734693633e-01, 2.441187637301263180e+01], 
-[8.302175681319752698e+00, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[9.111627561154895361e+00, 1.000000000000000021e-03, 4.330306305876258088e-02], 
-[9.111627561154895361e+00, 1.148922311909569708e-03, 4.325290581342928348e-02], 
-[9.111627561154895361e+00, 1.320022478803632065e-03, 4.320362267591427302e-02], 
-[9.111627561154895361e+00, 1.516603278119670137e-03, 4.315534400217267696e-02], 
-[9.111627561154895361e+00, 1.742459344546885402e-03, 4.310821982589370382e-02], 
-[9.111627561154895361e+00, 2.001950418545241171e-03, 4.306242290430038061e-02], 
-[9.111627561154895361e+00, 2.300085503203331758e-03, 4.301815225901815115e-02], 
-[9.111627561154895361e+00, 2.642619553930058204e-03, 4.297563729979786418e-02], 
-[9.111627561154895361e+00, 3.036164567398761706e-03, 4.293514263655534569e-02], 
-[9.111627561154895361e+00, 3.488317214113704091e-03, 4.289697370719036673e-02], 
-[9.111627561154895361e+00, 4.007805478313466660e-03, 4.286148337570883093e-02], 
-[9.111627561154895361e+00, 4.604657135827751671e-03, 4.282907968943380772e-02], 
-[9.111627561154895361e+00, 5.290393322046124149e-03, 4.280023502678785563e-02], 
-[9.111627561154895361e+00, 6.078250926476181683e-03, 4.277549692141205395e-02], 
-[9.111627561154895361e+00, 6.983438106813499684e-03, 4.275550091741511793e-02], 
-[9.111627561154895361e+00, 8.023427854757562983e-03, 4.274098589897595141e-02], 
-[9.111627561154895361e+00, 9.218295280327699903e-03, 4.273281245160111264e-02], 
-[9.111627561154895361e+00, 1.059110512533918171e-02, 4.273198496014860709e-02], 
-[9.111627561154895361e+00, 1.216835698628199354e-02, 4.273967834198404148e-02], 
-[9.111627561154895361e+00, 1.398049684082008047e-02, 4.275727056738214127e-02], 
-[9.111627561154895361e+00, 1.606250475199945058e-02, 4.278638245521437788e-02], 
-[9.111627561154895361e+00, 1.845457009472566828e-02, 4.282892667959128929e-02], 
-[9.111627561154895361e+00, 2.120286733852943389e-02, 4.288716852411711411e-02], 
-[9.111627561154895361e+00, 2.436044736169515681e-02, 4.296380173365033084e-02], 
-[9.111627561154895361e+00, 2.798826150195019707e-02, 4.306204392310732099e-02], 
-[9.111627561154895361e+00, 3.215633811115024138e-02, 4.318575753064080036e-02], 
-[9.111627561154895361e+00, 3.694513432520856594e-02, 4.333960442629156140e-02], 
-[9.111627561154895361e+00, 4.244708914272822542e-02, 4.352924527099905072e-02], 
-[9.111627561154895361e+00, 4.876840779169493850e-02, 4.376159896091784407e-02], 
-[9.111627561154895361e+00, 5.603111182818285713e-02, 4.404518359394474225e-02], 
-[9.111627561154895361e+00, 6.437539454049952259e-02, 4.439056929918976102e-02], 
-[9.111627561154895361e+00, 7.396232712556144451e-02, 4.481098646282490050e-02], 
-[9.111627561154895361e+00, 8.497696787531199003e-02, 4.532315276546478727e-02], 
-[9.111627561154895361e+00, 9.763193439036874088e-02, 4.594841297833806432e-02], 
-[9.111627561154895361e+00, 1.121715077759858903e-01, 4.671433334859469155e-02], 
-[9.111627561154895361e+00, 1.288763480443681220e-01, 4.765696928471366972e-02], 
-[9.111627561154895361e+00, 1.480689117455977755e-01, 4.882415179709123643e-02], 
-[9.111627561154895361e+00, 1.701196764046864207e-01, 5.028035343089726911e-02], 
-[9.111627561154895361e+00, 1.954542919161802172e-01, 5.211407272969314358e-02], 
-[9.111627561154895361e+00, 2.245617969409859638e-01, 5.444936742337676966e-02], 
-[9.111627561154895361e+00, 2.580040589080049296e-01, 5.746448745590169299e-02], 
-[9.111627561154895361e+00, 2.964266198426381838e-01, 6.142322018546758633e-02], 
-[9.111627561154895361e+00, 3.405711573811430193e-01, 6.673026799704112610e-02], 
-[9.111627561154895361e+00, 3.912898015080607528e-01, 7.403518374070199026e-02], 
-[9.111627561154895361e+00, 4.495615833752782953e-01, 8.444293713627271103e-02], 
-[9.111627561154895361e+00, 5.165113337172515529e-01, 9.998521459068920869e-02], 
-[9.111627561154895361e+00, 5.934313956619206021e-01, 1.248287063351139203e-01], 
-[9.111627561154895361e+00, 6.818065710636164178e-01, 1.690500091157170759e-01], 
-[9.111627561154895361e+00, 7.833427819015473803e-01, 2.649259222387806423e-01], 
-[9.111627561154895361e+00, 9.000000000000000222e-01, 6.066893278211182849e-01], 
-[9.111627561154895361e+00, 9.020408163265306589e-01, 6.196286099302998895e-01], 
-[9.111627561154895361e+00, 9.040816326530612956e-01, 6.330990322334886233e-01], 
-[9.111627561154895361e+00, 9.061224489795918213e-01, 6.471343027699099082e-01], 
-[9.111627561154895361e+00, 9.081632653061224580e-01, 6.617710653832871159e-01], 
-[9.111627561154895361e+00, 9.102040816326530948e-01, 6.770492279139015412e-01], 
-[9.111627561154895361e+00, 9.122448979591837315e-01, 6.930123355591304435e-01], 
-[9.111627561154895361e+00, 9.142857142857142572e-01, 7.097079968413972928e-01], 
-[9.111627561154895361e+00, 9.163265306122448939e-01, 7.271883710589470695e-01], 
-[9.111627561154895361e+00, 9.183673469387755306e-01, 7.455107278511257096e-01], 
-[9.111627561154895361e+00, 9.204081632653061673e-01, 7.647380916679499263e-01], 
-[9.111627561154895361e+00, 9.224489795918368040e-01, 7.849399865978401447e-01], 
-[9.111627561154895361e+00, 9.244897959183673297e-01, 8.061933003136371179e-01], 
-[9.111627561154895361e+00, 9.265306122448979664e-01, 8.285832900216858476e-01], 
-[9.111627561154895361e+00, 9.285714285714286031e-01, 8.522047584742462600e-01], 
-[9.111627561154895361e+00, 9.306122448979592399e-01, 8.771634346376148139e-01], 
-[9.111627561154895361e+00, 9.326530612244897656e-01, 9.035776019049459595e-01], 
-[9.111627561154895361e+00, 9.346938775510204023e-01, 9.315800273503906936e-01], 
-[9.111627561154895361e+00, 9.367346938775510390e-01, 9.613202591786156326e-01], 
-[9.111627561154895361e+00, 9.387755102040816757e-01, 9.929673772387797026e-01], 
-[9.111627561154895361e+00, 9.408163265306123124e-01, 1.026713304631394097e+00], 
-[9.111627561154895361e+00, 9.428571428571428381e-01, 1.062776818966878700e+00], 
-[9.111627561154895361e+00, 9.448979591836734748e-01, 1.101408442442608049e+00], 
-[9.111627561154895361e+00, 9.469387755102041115e-01, 1.142896444430300473e+00], 
-[9.111627561154895361e+00, 9.489795918367347483e-01, 1.187574264226039844e+00], 
-[9.111627561154895361e+00, 9.510204081632652739e-01, 1.235829763033697848e+00], 
-[9.111627561154895361e+00, 9.530612244897959107e-01, 1.288116854959121760e+00], 
-[9.111627561154895361e+00, 9.551020408163265474e-01, 1.344970264479687039e+00], 
-[9.111627561154895361e+00, 9.571428571428571841e-01, 1.407024439403619542e+00], 
-[9.111627561154895361e+00, 9.591836734693878208e-01, 1.475038055282937410e+00], 
-[9.111627561154895361e+00, 9.612244897959183465e-01, 1.549926144970060093e+00], 
-[9.111627561154895361e+00, 9.632653061224489832e-01, 1.632802780482927041e+00], 
-[9.111627561154895361e+00, 9.653061224489796199e-01, 1.725038595857448120e+00], 
-[9.111627561154895361e+00, 9.673469387755102566e-01, 1.828339558885774707e+00], 
-[9.111627561154895361e+00, 9.693877551020407823e-01, 1.944856776692646783e+00], 
-[9.111627561154895361e+00, 9.714285714285714191e-01, 2.077342644416061646e+00], 
-[9.111627561154895361e+00, 9.734693877551020558e-01, 2.229377952683034181e+00], 
-[9.111627561154895361e+00, 9.755102040816326925e-01, 2.405710777032392222e+00], 
-[9.111627561154895361e+00, 9.775510204081632182e-01, 2.612777287830073014e+00], 
-[9.111627561154895361e+00, 9.795918367346938549e-01, 2.859530007432342202e+00], 
-[9.111627561154895361e+00, 9.816326530612244916e-01, 3.158809146686715863e+00], 
-[9.111627561154895361e+00, 9.836734693877551283e-01, 3.529725076207268053e+00], 
-[9.111627561154895361e+00, 9.857142857142857650e-01, 4.002047350141534565e+00], 
-[9.111627561154895361e+00, 9.877551020408162907e-01, 4.624903289031866649e+00], 
-[9.111627561154895361e+00, 9.897959183673469274e-01, 5.485716117049591389e+00], 
-[9.111627561154895361e+00, 9.918367346938775642e-01, 6.756971268356735116e+00], 
-[9.111627561154895361e+00, 9.938775510204082009e-01, 8.834411651759621620e+00], 
-[9.111627561154895361e+00, 9.959183673469387266e-01, 1.287890440521276680e+01], 
-[9.111627561154895361e+00, 9.979591836734693633e-01, 2.449282373113875622e+01], 
-[9.111627561154895361e+00, 1.000000000000000000e+00, 0.000000000000000000e+00], 
-[1.000000000000000000e+01, 1.000000000000000021e-03, 4.358044555610756515e-02], 
-[1.000000000000000000e+01, 1.148922311909569708e-03, 4.352964891752735682e-02], 
-[1.000000000000000000e+01, 1.320022478803632065e-03, 4.347973144279334429e-02], 
-[1.000000000000000000e+01, 1.516603278119670137e-03, 4.343082423548254301e-02], 
-[1.000000000000000000e+01, 1.742459344546885402e-03, 4.338307818882948530e-02], 
-[1.000000000000000000e+01, 2.001950418545241171e-03, 4.333666704871601966e-02], 
-[1.000000000000000000e+01, 2.300085503203331758e-03, 4.329179097450772118e-02], 
-[1.000000000000000000e+01, 2.642619553930058204e-03, 4.324868068601071813e-02], 
-[1.000000000000000000e+01, 3.036164567398761706e-03, 4.320760230260153184e-02], 
-[1.000000000000000000e+01, 3.488317214113704091e-03, 4.316886300269961313e-02], 
-[1.000000000000000000e+01, 4.007805478313466660e-03, 4.313281765897392095e-02], 
-[1.000000000000000000e+01, 4.604657135827751671e-03, 4.309987663911545031e-02], 
-[1.000000000000000000e+01, 5.290393322046124149e-03, 4.307051500495021751e-02], 
-[1.000000000000000000e+01, 6.078250926476181683e-03, 4.304528339725322006e-02], 
-[1.000000000000000000e+01, 6.983438106813499684e-03, 4.302482096298354541e-02], 
-[1.000000000000000000e+01, 8.023427854757562983e-03, 4.300987077076449949e-02], 
-[1.000000000000000000e+01, 9.218295280327699903e-03, 4.300129827476827094e-02], 
-[1.000000000000000000e+01, 1.059110512533918171e-02, 4.300011353625825261e-02], 
-[1.000000000000000000e+01, 1.216835698628199354e-02, 4.300749810598316486e-02], 
-[1.000000000000000000e+01, 1.398049684082008047e-02, 4.302483772594757616e-02], 
-[1.000000000000000000e+01, 1.606250475199945058e-02, 4.305376234679780811e-02], 
-[1.000000000000000000e+01, 1.845457009472566828e-02, 4.309619540714351715e-02], 
-[1.000000000000000000e+01, 2.120286733852943389e-02, 4.315441492540213198e-02], 
-[1.000000000000000000e+01, 2.436044736169515681e-02, 4.323112977241112126e-02], 
-[1.000000000000000000e+01, 2.798826150195019707e-02, 4.332957560871444902e-02], 
-[1.000000000000000000e+01, 3.215633811115024138e-02, 4.345363650647964676e-02], 
-[1.000000000000000000e+01, 3.694513432520856594e-02, 4.360800041121586784e-02], 
-[1.000000000000000000e+01, 4.244708914272822542e-02, 4.379835959826554326e-02], 
-[1.000000000000000000e+01, 4.876840779169493850e-02, 4.403167154179089826e-02], 
-[1.000000000000000000e+01, 5.603111182818285713e-02, 4.431650174845157275e-02], 
-[1.000000000000000000e+01, 6.437539454049952259e-02, 4.466347905906210142e-02], 
-[1.000000000000000000e+01, 7.396232712556144451e-02, 4.508590718395079355e-02], 
-[1.000000000000000000e+01, 8.497696787531199003e-02, 4.560059622409191882e-02], 
-[1.000000000000000000e+01, 9.763193439036874088e-02, 4.622900862212080131e-02], 
-[1.000000000000000000e+01, 1.121715077759858903e-01, 4.699886212003382552e-02], 
-[1.000000000000000000e+01, 1.288763480443681220e-01, 4.794640957970959516e-02], 
-[1.000000000000000000e+01, 1.480689117455977755e-01, 4.911974292027675160e-02], 
-[1.000000000000000000e+01, 1.701196764046864207e-01, 5.058368481249779502e-02], 
-[1.000000000000000000e+01, 1.954542919161802172e-01, 5.242721200021475958e-02], 
-[1.000000000000000000e+01, 2.245617969409859638e-01, 5.477504877447823828e-02], 
-[1.000000000000000000e+01, 2.580040589080049296e-01, 5.780639669141593440e-02], 
-[1.000000000000000000e+01, 2.964266198426381838e-01, 6.178644112582478559e-02], 
-[1.000000000000000000e+01, 3.405711573811430193e-01, 6.712201141616772060e-02], 
-[1.000000000000000000e+01, 3.912898015080607528e-01, 7.446604130431375146e-02], 
-[1.000000000000000000e+01, 4.495615833752782953e-01, 8.492918696642792753e-02], 
-[1.000000000000000000e+01, 5.165113337172515529e-01, 1.005534499214241761e-01], 
-[1.000000000000000000e+01, 5.934313956619206021e-01, 1.255263273352762998e-01], 
-[1.000000000000000000e+01, 6.818065710636164178e-01, 1.699736760173684302e-01], 
-[1.000000000000000000e+01, 7.833427819015473803e-01, 2.663254561330320458e-01], 
-[1.000000000000000000e+01, 9.000000000000000222e-01, 6.096890294615964212e-01], 
-[1.000000000000000000e+01, 9.020408163265306589e-01, 6.226868338661534219e-01], 
-[1.000000000000000000e+01, 9.040816326530612956e-01, 6.362180539897566156e-01], 
-[1.000000000000000000e+01, 9.061224489795918213e-01, 6.503165369599299694e-01], 
-[1.000000000000000000e+01, 9.081632653061224580e-01, 6.650190774772841706e-01], 
-[1.000000000000000000e+01, 9.102040816326530948e-01, 6.803657472922534089e-01], 
-[1.000000000000000000e+01, 9.122448979591837315e-01, 6.964002700234690479e-01], 
-[1.000000000000000000e+01, 9.142857142857142572e-01, 7.131704487849011009e-01], 
-[1.000000000000000000e+01, 9.163265306122448939e-01, 7.307286555303484921e-01], 
-[1.000000000000000000e+01, 9.183673469387755306e-01, 7.491323927869071309e-01], 
-[1.000000000000000000e+01, 9.204081632653061673e-01, 7.684449406149564954e-01], 
-[1.000000000000000000e+01, 9.224489795918368040e-01, 7.887361043061349442e-01], 
-[1.000000000000000000e+01, 9.244897959183673297e-01, 8.100830816491286779e-01], 
-[1.000000000000000000e+01, 9.265306122448979664e-01, 8.325714727328470399e-01], 
-[1.000000000000000000e+01, 9.285714285714286031e-01, 8.562964604508762623e-01], 
-[1.000000000000000000e+01, 9.306122448979592399e-01, 8.813641964269729456e-01], 
-[1.000000000000000000e+01, 9.326530612244897656e-01, 9.078934354079779556e-01], 
-[1.000000000000000000e+01, 9.346938775510204023e-01, 9.360174718164606666e-01], 
-[1.000000000000000000e+01, 9.367346938775510390e-01, 9.658864458619409454e-01], 
-[1.000000000000000000e+01, 9.387755102040816757e-01, 9.976701043880433772e-01], 
-[1.000000000000000000e+01, 9.408163265306123124e-01, 1.031561124874948776e+00], 
-[1.000000000000000000e+01, 9.428571428571428381e-01, 1.067779141655493813e+00], 
-[1.000000000000000000e+01, 9.448979591836734748e-01, 1.106575654155090849e+00], 
-[1.000000000000000000e+01, 9.469387755102041115e-01, 1.148240051683059315e+00], 
-[1.000000000000000000e+01, 9.489795918367347483e-01, 1.193107063523224598e+00], 
-[1.000000000000000000e+01, 9.510204081632652739e-01, 1.241566044844819583e+00], 
-[1.000000000000000000e+01, 9.530612244897959107e-01, 1.294072650151158355e+00], 
-[1.000000000000000000e+01, 9.551020408163265474e-01, 1.351163644355701798e+00], 
-[1.000000000000000000e+01, 9.571428571428571841e-01, 1.413475884095468427e+00], 
-[1.000000000000000000e+01, 9.591836734693878208e-01, 1.481770910236634098e+00], 
-[1.000000000000000000e+01, 9.612244897959183465e-01, 1.556967192291618396e+00], 
-[1.000000000000000000e+01, 9.632653061224489832e-01, 1.640182961970799269e+00], 
-[1.000000000000000000e+01, 9.653061224489796199e-01, 1.732793939193421506e+00], 
-[1.000000000000000000e+01, 9.673469387755102566e-01, 1.836512380195985727e+00], 
-[1.000000000000000000e+01, 9.693877551020407823e-01, 1.953497265656816140e+00], 
-[1.000000000000000000e+01, 9.714285714285714191e-01, 2.086510989299579677e+00], 
-[1.000000000000000000e+01, 9.734693877551020558e-01, 2.239147244332580389e+00], 
-[1.000000000000000000e+01, 9.755102040816326925e-01, 2.416171065157368680e+00], 
-[1.000000000000000000e+01, 9.775510204081632182e-01, 2.624041391473878715e+00], 
-[1.000000000000000000e+01, 9.795918367346938549e-01, 2.871742086520226778e+00], 
-[1.000000000000000000e+01, 9.816326530612244916e-01, 3.172157793369469569e+00], 
-[1.000000000000000000e+01, 9.836734693877551283e-01, 3.544464159913388368e+00], 
-[1.000000000000000000e+01, 9.857142857142857650e-01, 4.018530944630388291e+00], 
-[1.000000000000000000e+01, 9.877551020408162907e-01, 4.643648057476026381e+00], 
-[1.000000000000000000e+01, 9.897959183673469274e-01, 5.507522350413022849e+00], 
-[1.000000000000000000e+01, 9.918367346938775642e-01, 6.783185484208376081e+00], 
-[1.000000000000000000e+01, 9.938775510204082009e-01, 8.867595614290337380e+00], 
-[1.000000000000000000e+01, 9.959183673469387266e-01, 1.292503622876680325e+01], 
-[1.000000000000000000e+01, 9.979591836734693633e-01, 2.457324105146823712e+01], 
-[1.000000000000000000e+01, 1.000000000000000000e+00, 0.000000000000000000e+00]])
-
-log_lumi_integral_list = np.log10(lumi_integral_list+1e-99) 
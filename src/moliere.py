@@ -1,5 +1,4 @@
 import numpy as np
-from scipy import integrate, special, optimize
 import random
 import math
 try:
@@ -41,6 +40,7 @@ def moliere_f1(x):
     Next-to-leading order multiple scattering distribution in x = theta^2 / (chi_c^2 B)
     Eq. 28 in Bethe 1952
     """
+    from scipy import special
     if x <= 100.:
         if x>1E-6:
             return 2.*np.exp(-x)*(x-1.)*(special.expi(x)-math.log(x)) - 2.*(1.-2.*np.exp(-x))
@@ -75,6 +75,7 @@ def moliere_cdf(x, B):
     elif x<0.01:
         return moliere_f(0,B)*x
     else:
+        from scipy import integrate
         integrand = lambda xp: moliere_f(xp, B)
         return integrate.quad(integrand, 0., x)[0]
 
@@ -116,6 +117,7 @@ def inverse_moliere_cdf(u, B):
 
             continue
 
+        from scipy import optimize
         return optimize.root_scalar(f, x0=guess, bracket=[a,b], method='ridder').root
      
 
@@ -1,3 +1,4 @@
+import math
 import numpy as np
 from .physical_constants import *
 
@@ -13,7 +14,8 @@ default_ids = {"PID":11, "ID":1, "parent_PID":22,
                "mass":None, "stability":"stable",
                "production_time":0.0,
                "decay_time":0.0,
-               "interaction_time":0.0}
+               "interaction_time":0.0,
+               "split_factor":1}
 
 #pi0 (111) decays to gamma gamma with Br = 0.98823
 #eta (221) decays to gamma gamma with Br = 0.3936
@@ -27,9 +29,51 @@ meson_decay_dict = {111: [[0.98823, [22,22]]],
                     331: [[0.02307, [22,22]], [0.224, [111, 111, 221]], [0.00250, [111, 111, 111]]]}
 meson_twobody_branchingratios = {pid0:meson_decay_dict[pid0][0][0] for pid0 in meson_decay_dict.keys()}
 
+def dalitz_range(m12sq, m1, m2, m3, M):
+    """Returns the allowed range (m23sq_min, m23sq_max) of m23^2 given m12^2 for the
+    three-body decay M -> 1 + 2 + 3 (works elementwise on arrays)
+    """
+    E2s = (m12sq - m1**2 + m2**2)/(2*np.sqrt(m12sq))
+    E3s = (M**2 - m12sq - m3**2)/(2*np.sqrt(m12sq))
+    m23sqmin = (E2s + E3s)**2 - (np.sqrt(E2s**2 - m2**2) + np.sqrt(E3s**2 - m3**2))**2
+    m23sqmax = (E2s + E3s)**2 - (np.sqrt(E2s**2 - m2**2) - np.sqrt(E3s**2 - m3**2))**2
+    return m23sqmin, m23sqmax
+
+def energy_loss_fourvector(four_momentum, mass, value):
+    """Returns the four-momentum after losing energy `value' at fixed direction (the energy
+    does not drop below the mass; a particle at rest keeps its four-momentum). The input is not modified.
+    """
+    E0, px0, py0, pz0 = four_momentum
+    p30 = np.linalg.norm([px0, py0, pz0])
+    E_updated = E0 - value
+    if E_updated < mass:
+        E_updated = mass
+    p3f = np.sqrt(E_updated**2 - mass**2)
+    if p3f > 0.0:
+        return [E_updated, px0/p30*p3f, py0/p30*p3f, pz0/p30*p3f]
+    return four_momentum
+
+def rotation_matrix(four_momentum):
+    """
+    Determines the rotation matrix between the z-axis and the three-momentum of four_momentum
+    """
+    E0, px0, py0, pz0 = four_momentum
+    ThZ = np.arccos(pz0/np.sqrt(px0**2 + py0**2 + pz0**2))
+    PhiZ = np.arctan2(py0, px0)
+    return [[np.cos(ThZ)*np.cos(PhiZ), -np.sin(PhiZ), np.sin(ThZ)*np.cos(PhiZ)],
+        [np.cos(ThZ)*np.sin(PhiZ), np.cos(PhiZ), np.sin(ThZ)*np.sin(PhiZ)],
+        [-np.sin(ThZ), 0, np.cos(ThZ)]]
+
 class Particle:
     """Container for particle information as it is propagated through target
+
+    The identification information of default_ids (PID, ID, parent, generation, weight,
+    mass, stability, ...) is stored as plain attributes in __slots__ rather than in a
+    per-instance dictionary, since showers create many thousands of particles.
+    get_ids() builds the equivalent dictionary on demand.
     """
+    __slots__ = tuple(default_ids.keys()) + ("_p0", "_r0", "_pf", "_rf", "ended")
+
     def __init__(self, p0, r0=np.array([0,0,0]), id_dictionary=None):
         """Initializes an instance of the Particle class
         Args:
@@ -48,67 +92,84 @@ class Particle:
                 --weight (used for dark-particle generation for weighted showers) -- default:1
                 --mass (mass of the particle) -- default:None (gets set later)
                 --stability (string identifying whether particle is stable/short-lived/long-lived) -- default:"stable"
+                --split_factor (number of emissions the weight of a dark-particle emission was split into) -- default:1
         """
 
         if id_dictionary is None:
             id_dictionary = {}
         self.set_ids(id_dictionary)
 
-        self.set_mass(self.get_ids()['mass'])
         if type(p0) is list:
             p0 = np.array(p0)
         #if p0 is given as a number, assume it to be the particle's energy,
         #momentum pointing in z-direction
         elif type(p0) is int or type(p0) is float:
-            if self.get_ids()["mass"] is None:
-                self._mass = mass_dict[self.get_ids()["PID"]]
-            p0 = np.array([p0, 0, 0, np.sqrt(p0**2 - self._mass**2)])
+            if self.mass is None:
+                self.mass = mass_dict[self.PID]
+            p0 = np.array([p0, 0, 0, np.sqrt(p0**2 - self.mass**2)])
         self.set_p0(p0)
         if type(r0) is list:
             r0 = np.array(r0)
         self.set_r0(r0)
 
         # the ended key is used to determine whether the particle is an intermediate particle in the shower (False) or a final particle (True)
-        self.set_ended(False)
+        self.ended = False
 
         self.set_pf(p0)
         self.set_rf(r0)
 
-    def set_ids(self, value):
-        self._IDs = {}
+    def __getstate__(self):
+        return {key:getattr(self, key) for key in self.__slots__}
+
+    def __setstate__(self, state):
+        #Particles pickled before the switch to __slots__ store their IDs in an '_IDs' dictionary
+        if isinstance(state, tuple):
+            state = state[1]
+        if "_IDs" in state:
+            state = dict(state)
+            state.update(state.pop("_IDs"))
+            state["ended"] = state.pop("_Ended")
+            if state.get("mass") is None:
+                state["mass"] = state.pop("_mass", None)
         for key in default_ids.keys():
-            if key in value.keys():
-                self._IDs[key] = value[key]
-            else:
-                self._IDs[key] = default_ids[key]
+            setattr(self, key, state.get(key, default_ids[key]))
+        for key in ("_p0", "_r0", "_pf", "_rf", "ended"):
+            setattr(self, key, state[key])
+
+    def set_ids(self, value):
+        for key, default in default_ids.items():
+            setattr(self, key, value.get(key, default))
     def get_ids(self):
-        return self._IDs
+        """Returns a dictionary of the particle's identification information (built on demand)
+        """
+        return {key:getattr(self, key) for key in default_ids}
     
     def update_ids(self, key, value):
-        self._IDs[key] = value
+        if key not in default_ids:
+            raise KeyError("Unknown particle identification key: " + str(key))
+        setattr(self, key, value)
 
     def get_pid(self):
         """Returns PID of particle in shower
         """
-        return self._IDs["PID"]
+        return self.PID
     def get_parent_pid(self):
         """Returns PID of particle's parent in shower
         """
-        return self._IDs["parent_PID"]
+        return self.parent_PID
     def get_weight(self):
         """Returns weight of particle in shower
         """
-        return self._IDs["weight"]
+        return self.weight
 
     def set_mass(self, value):
-        self._mass = value
+        self.mass = value
     def set_p0(self, value):
         self._p0 = value
-        if self._mass is None:
-            #else: #If mass is not provided, set it here
-            invariant_mass = round(np.sqrt(round(value[0]**2 - value[1]**2 - value[2]**2 - value[3]**2, 12)),6)
-            self._mass = invariant_mass
-            self._IDs["mass"] = invariant_mass
+        if self.mass is None:
+            #If mass is not provided, set it here
+            E0, px0, py0, pz0 = float(value[0]), float(value[1]), float(value[2]), float(value[3])
+            self.mass = round(math.sqrt(max(round(E0*E0 - px0*px0 - py0*py0 - pz0*pz0, 12), 0.0)), 6)
     def get_p0(self):
         return self._p0
     def set_pf(self, value):
@@ -121,14 +182,7 @@ class Particle:
         return np.arccos(pz0/np.sqrt(px0**2 + py0**2 + pz0**2))
 
     def lose_energy(self, value):
-        E0, px0, py0, pz0 = self.get_pf()
-        p30 = np.linalg.norm([px0, py0, pz0])
-        E_updated = E0 - value
-        if E_updated < self.get_ids()["mass"]:
-            E_updated = self.get_ids()["mass"]
-        p3f = np.sqrt(E_updated**2 - self.get_ids()["mass"]**2)
-        if p3f > 0.0:
-            self.set_pf([E_updated, px0/p30*p3f, py0/p30*p3f, pz0/p30*p3f])
+        self.set_pf(energy_loss_fourvector(self.get_pf(), self.mass, value))
 
     def set_r0(self, value):
         self._r0 = value
@@ -143,10 +197,10 @@ class Particle:
         '''Sets the ended property of the particle. If True, the particle is a final particle in the shower.'''
         if value != True and value != False:
             raise ValueError("Ended property must be a boolean.")
-        self._Ended = value
+        self.ended = value
 
     def get_ended(self):
-        return self._Ended
+        return self.ended
 
     def copy(self):
         return Particle(self.get_p0(), self.get_r0(), self.get_ids())
@@ -155,19 +209,14 @@ class Particle:
         """
         Determines the rotation matrix between the z-axis and the particle's (final) three-momentum
         """
-        E0, px0, py0, pz0 = self.get_pf()
-        ThZ = np.arccos(pz0/np.sqrt(px0**2 + py0**2 + pz0**2))
-        PhiZ = np.arctan2(py0, px0)
-        return [[np.cos(ThZ)*np.cos(PhiZ), -np.sin(PhiZ), np.sin(ThZ)*np.cos(PhiZ)],
-            [np.cos(ThZ)*np.sin(PhiZ), np.cos(PhiZ), np.sin(ThZ)*np.sin(PhiZ)],
-            [-np.sin(ThZ), 0, np.cos(ThZ)]]
+        return rotation_matrix(self.get_pf())
 
     def boost_matrix(self):
         """
         Determines the boost matrix between the particle's rest-frame and lab-frame
         """
         E0, px0, py0, pz0 = self.get_pf()
-        m0 = self._mass
+        m0 = self.mass
 
         gamma = E0/m0
         beta = np.sqrt(1.0 - 1.0/gamma**2)
@@ -182,7 +231,7 @@ class Particle:
                 [gamma*betaz, (gamma-1)*betaz*betax/beta**2, (gamma-1)*betaz*betay/beta**2, 1 + (gamma-1)*betaz**2/beta**2]]
 
     def two_body_decay(self, p1_dict, p2_dict, angular_information="Isotropic"):
-        mX = self._mass
+        mX = self.mass
         if ("mass") not in p1_dict.keys():
             if ("PID") not in p1_dict.keys():
                 raise ValueError("Masses must be included in `p1_dict' when calling two_body_decay()")
@@ -232,14 +281,10 @@ class Particle:
     
     def dalitz_range(self, m12sq, m1, m2, m3, M):
         #returns the allowed range for m23sq given m12sq
-        E2s = (m12sq - m1**2 + m2**2)/(2*np.sqrt(m12sq))
-        E3s = (M**2 - m12sq - m3**2)/(2*np.sqrt(m12sq))
-        m23sqmin = (E2s + E3s)**2 - (np.sqrt(E2s**2 - m2**2) + np.sqrt(E3s**2 - m3**2))**2
-        m23sqmax = (E2s + E3s)**2 - (np.sqrt(E2s**2 - m2**2) - np.sqrt(E3s**2 - m3**2))**2
-        return m23sqmin, m23sqmax
+        return dalitz_range(m12sq, m1, m2, m3, M)
 
     def three_body_decay(self, p1_dict, p2_dict, p3_dict, dalitz_information="Flat", angular_information="Isotropic"):
-        mX = self._mass
+        mX = self.mass
         if ("mass") not in p1_dict.keys():
             if ("PID") not in p1_dict.keys():
                 raise ValueError("Masses must be included in `p1_dict' when calling three_body_decay()")
@@ -321,9 +366,9 @@ class Particle:
         return [new_particle_1, new_particle_2, new_particle_3]
 
     def decay_particle(self):
-        if self.get_ids()["PID"] not in meson_decay_dict.keys():
+        if self.PID not in meson_decay_dict.keys():
             raise ValueError("Decay options for particle not specified. Edit dictionary in 'particle.py' to include it")
-        decay_options = meson_decay_dict[self.get_ids()["PID"]]
+        decay_options = meson_decay_dict[self.PID]
         if len(decay_options) == 1:
             br_sum, decay = decay_options[0]
         else:
@@ -332,12 +377,247 @@ class Particle:
             choice_weights = branching_ratios/br_sum
             decay = decay_options[np.random.choice(range(len(decay_options)), p=choice_weights)][1]
 
-        if len(decay) > 2:
-            raise ValueError("Three-body (and above) decays not yet implemented")
+        if len(decay) > 3:
+            raise ValueError("Four-body (and above) decays not yet implemented")
+        elif len(decay) == 3:
+            mX = mass_dict[self.PID] if self.mass is None else self.mass
+            daughter_four_momenta = three_body_decay_batch(np.array([self.get_pf()]), np.array([mX]), *[mass_dict[PID] for PID in decay])
+            #IDs follow the binary shower tree as if the decay were X -> 1 + (23), (23) -> 2 + 3: the
+            #intermediate node 2*ID+1 is never given to a particle, so its children 4*ID+2, 4*ID+3 are unique
+            daughter_IDs = [2*(self.ID), 4*(self.ID)+2, 4*(self.ID)+3]
+            new_particles = []
+            for PID, ID, four_momenta in zip(decay, daughter_IDs, daughter_four_momenta):
+                p_dict = {"PID":PID, "mass":mass_dict[PID], "weight":self.weight*br_sum, "ID":ID, "parent_PID":self.PID, "parent_ID":self.ID,
+                          "generation_process":"SMDecay", "generation_number":(self.generation_number+1), "production_time":self.decay_time,
+                          "stability":"short-lived" if PID in meson_decay_dict.keys() else "stable"}
+                new_particles.append(Particle(four_momenta[0], self.get_rf(), p_dict))
         elif len(decay) == 2:
-            p1_dict = {"PID":decay[0], "weight":self.get_ids()["weight"]*br_sum, "ID":2*(self.get_ids()["ID"]), "generation_process":"SMDecay", "generation_number":(self.get_ids()["generation_number"]+1), "production_time":self.get_ids()["decay_time"]}
-            p2_dict = {"PID":decay[1], "weight":self.get_ids()["weight"]*br_sum, "ID":2*(self.get_ids()["ID"])+1, "generation_process":"SMDecay", "generation_number":(self.get_ids()["generation_number"]+1), "production_time":self.get_ids()["decay_time"]}
+            p1_dict = {"PID":decay[0], "weight":self.weight*br_sum, "ID":2*(self.ID), "generation_process":"SMDecay", "generation_number":(self.generation_number+1), "production_time":self.decay_time}
+            p2_dict = {"PID":decay[1], "weight":self.weight*br_sum, "ID":2*(self.ID)+1, "generation_process":"SMDecay", "generation_number":(self.generation_number+1), "production_time":self.decay_time}
             new_particles = self.two_body_decay(p1_dict=p1_dict, p2_dict=p2_dict)
         
         self.set_ended(True)
-        return new_particles        
\ No newline at end of file
+        return new_particles        
+#-------------------------------------------------------------------
+#Vectorized decays of many mesons at once (e.g. pi0/eta/eta' beams)
+#-------------------------------------------------------------------
+def boost_to_lab(parent_four_momenta, rest_frame_four_momenta, parent_masses):
+    """Boosts four-vectors from the rest frames of their parents into the lab frame
+    Args:
+        parent_four_momenta: (N,4) array of lab-frame parent four-momenta
+        rest_frame_four_momenta: (N,4) array of four-vectors in the corresponding parent rest frames
+        parent_masses: (N,) array of parent masses
+    Returns:
+        (N,4) array of lab-frame four-vectors
+    """
+    E, p3 = parent_four_momenta[:,0], parent_four_momenta[:,1:]
+    e_star, k3_star = rest_frame_four_momenta[:,0], rest_frame_four_momenta[:,1:]
+    p_dot_k = np.sum(p3*k3_star, axis=1)
+    lab_four_vectors = np.empty(np.shape(rest_frame_four_momenta))
+    lab_four_vectors[:,0] = (E*e_star + p_dot_k)/parent_masses
+    lab_four_vectors[:,1:] = k3_star + p3*(e_star/parent_masses + p_dot_k/(parent_masses*(E + parent_masses)))[:,np.newaxis]
+    return lab_four_vectors
+
+def isotropic_directions(n, rng=None):
+    """Returns an (n,3) array of unit vectors drawn isotropically"""
+    rng = np.random if rng is None else rng
+    cos_theta = rng.uniform(-1.0, 1.0, size=n)
+    phi = rng.uniform(0.0, 2.0*np.pi, size=n)
+    sin_theta = np.sqrt(1.0 - cos_theta**2)
+    return np.transpose([sin_theta*np.cos(phi), sin_theta*np.sin(phi), cos_theta])
+
+def two_body_decay_batch(parent_four_momenta, parent_masses, m1, m2, rng=None):
+    """Isotropic two-body decays X -> 1 + 2 of an array of parents
+    Args:
+        parent_four_momenta: (N,4) array of lab-frame parent four-momenta
+        parent_masses: (N,) array of parent masses
+        m1, m2: daughter masses
+        rng: optional numpy random Generator (default: numpy's global random state)
+    Returns:
+        two (N,4) arrays of lab-frame four-momenta of daughters 1 and 2
+    """
+    mX = parent_masses
+    E1 = (mX**2 - m2**2 + m1**2)/(2*mX)
+    E2 = (mX**2 - m1**2 + m2**2)/(2*mX)
+    pF = np.sqrt(E1**2 - m1**2)
+    direction = isotropic_directions(len(mX), rng=rng)
+    p1_RF = np.column_stack([E1, -pF[:,np.newaxis]*direction])
+    p2_RF = np.column_stack([E2, pF[:,np.newaxis]*direction])
+    return boost_to_lab(parent_four_momenta, p1_RF, mX), boost_to_lab(parent_four_momenta, p2_RF, mX)
+
+def sample_decay_channels(parent_PIDs, rng=None):
+    """Draws a decay channel from meson_decay_dict for each parent
+    Args:
+        parent_PIDs: (N,) array of parent PDG IDs
+        rng: optional numpy random Generator (default: numpy's global random state)
+    Returns:
+        channels: (N,) array of indices into meson_decay_dict[PID]
+        br_sums: (N,) array of the summed branching ratios of the included channels for each parent
+            (as in Particle.decay_particle, daughters carry this factor in their weight)
+    """
+    rng = np.random if rng is None else rng
+    channels, br_sums = np.zeros(len(parent_PIDs), dtype=int), np.zeros(len(parent_PIDs))
+    for PID in np.unique(parent_PIDs):
+        if PID not in meson_decay_dict.keys():
+            raise ValueError("Decay options for particle not specified. Edit dictionary in 'particle.py' to include it")
+        rows = np.flatnonzero(parent_PIDs == PID)
+        branching_ratios = np.array([option[0] for option in meson_decay_dict[PID]])
+        cumulative = np.cumsum(branching_ratios)/np.sum(branching_ratios)
+        channels[rows] = np.minimum(np.searchsorted(cumulative, rng.random(len(rows)), side='right'), len(branching_ratios)-1)
+        br_sums[rows] = np.sum(branching_ratios)
+    return channels, br_sums
+
+def dalitz_sample_batch(parent_masses, m1, m2, m3, rng=None, oversampling=4):
+    """Draws points (m12^2, m23^2) uniformly over the Dalitz region of X -> 1 + 2 + 3 for an
+    array of parent masses by rejection sampling. Each pass draws `oversampling' candidates
+    for every parent still lacking a point, so nearly all parents are filled in the first pass.
+    Returns:
+        two (N,) arrays m12sq, m23sq
+    """
+    rng = np.random if rng is None else rng
+    mX = np.asarray(parent_masses, dtype=float)
+    m12sq, m23sq = np.empty(len(mX)), np.empty(len(mX))
+    remaining = np.arange(len(mX))
+    while len(remaining) > 0:
+        mX_r = mX[remaining][:,np.newaxis]
+        m12sq_min, m12sq_max = (m1 + m2)**2, (mX_r - m3)**2
+        m23sq_min, m23sq_max = (m2 + m3)**2, (mX_r - m1)**2
+        shape = (len(remaining), oversampling)
+        m12sq_try = m12sq_min + (m12sq_max - m12sq_min)*rng.random(shape)
+        m23sq_try = m23sq_min + (m23sq_max - m23sq_min)*rng.random(shape)
+        dr = dalitz_range(m12sq_try, m1, m2, m3, mX_r)
+        accepted = (m23sq_try > dr[0])*(m23sq_try < dr[1])
+        found = np.any(accepted, axis=1)
+        first = np.argmax(accepted, axis=1)[found]
+        m12sq[remaining[found]] = m12sq_try[found, first]
+        m23sq[remaining[found]] = m23sq_try[found, first]
+        remaining = remaining[~found]
+    return m12sq, m23sq
+
+def three_body_decay_batch(parent_four_momenta, parent_masses, m1, m2, m3, rng=None, oversampling=4):
+    """Vectorized version of Particle.three_body_decay (flat Dalitz distribution, isotropic
+    orientation) for an array of parents
+    Args:
+        parent_four_momenta: (N,4) array of lab-frame parent four-momenta
+        parent_masses: (N,) array of parent masses
+        m1, m2, m3: daughter masses
+        rng: optional numpy random Generator (default: numpy's global random state)
+        oversampling: number of Dalitz-plot candidates drawn per parent in each rejection pass
+    Returns:
+        three (N,4) arrays of lab-frame four-momenta of daughters 1, 2 and 3
+    """
+    rng = np.random if rng is None else rng
+    mX = np.asarray(parent_masses, dtype=float)
+    m12sq, m23sq = dalitz_sample_batch(mX, m1, m2, m3, rng=rng, oversampling=oversampling)
+
+    E1 = (mX**2 - m23sq + m1**2)/(2*mX)
+    E3 = (mX**2 - m12sq + m3**2)/(2*mX)
+    E2 = mX - E1 - E3
+    p1, p2 = np.sqrt(np.maximum(E1**2 - m1**2, 0.0)), np.sqrt(np.maximum(E2**2 - m2**2, 0.0))
+
+    #opening angle between p1 and p2 three-vectors in X rest-frame
+    cos_theta_12 = np.clip((m1**2 + m2**2 + 2*E1*E2 - m12sq)/(2*p1*p2), -1.0, 1.0)
+    sin_theta_12 = np.sqrt(1 - cos_theta_12**2)
+
+    n_parents = len(mX)
+    cos_theta = rng.uniform(-1.0, 1.0, size=n_parents)
+    phi, gamma = rng.uniform(0.0, 2.0*np.pi, size=n_parents), rng.uniform(0.0, 2.0*np.pi, size=n_parents)
+    sin_theta = np.sqrt(1 - cos_theta**2)
+    sin_phi, cos_phi, sin_gamma, cos_gamma = np.sin(phi), np.cos(phi), np.sin(gamma), np.cos(gamma)
+
+    p1_RF = np.column_stack([E1, -p1*sin_theta*sin_phi, -p1*sin_theta*cos_phi, -p1*cos_theta])
+    p2_RF = np.column_stack([E2, p2*(sin_theta_12*cos_phi*sin_gamma - sin_theta_12*cos_gamma*cos_theta*sin_phi - cos_theta_12*sin_theta*sin_phi),
+                                 p2*(-cos_phi*(sin_theta_12*cos_gamma*cos_theta + cos_theta_12*sin_theta) - sin_theta_12*sin_gamma*sin_phi),
+                                 p2*(sin_theta_12*cos_gamma*sin_theta - cos_theta_12*cos_theta)])
+    p3_RF = np.column_stack([E3, -p1_RF[:,1:] - p2_RF[:,1:]])
+
+    return (boost_to_lab(parent_four_momenta, p1_RF, mX), boost_to_lab(parent_four_momenta, p2_RF, mX),
+            boost_to_lab(parent_four_momenta, p3_RF, mX))
+
+def _decay_mesons_once(parent_four_momenta, parent_PIDs, parent_masses, rng=None):
+    """One step of decay_mesons: decays every parent once
+    Returns:
+        daughter four-momenta, daughter PIDs, parent indices and the summed branching ratio of each daughter's parent
+    """
+    channels, br_sums = sample_decay_channels(parent_PIDs, rng=rng)
+
+    four_momenta, PIDs, parent_indices, daughter_slots = [], [], [], []
+    for PID in np.unique(parent_PIDs):
+        for channel, (branching_ratio, decay) in enumerate(meson_decay_dict[PID]):
+            rows = np.flatnonzero((parent_PIDs == PID)*(channels == channel))
+            if len(rows) == 0:
+                continue
+            daughter_masses = [mass_dict[daughter_PID] for daughter_PID in decay]
+            if len(decay) == 2:
+                daughters = two_body_decay_batch(parent_four_momenta[rows], parent_masses[rows], *daughter_masses, rng=rng)
+            elif len(decay) == 3:
+                daughters = three_body_decay_batch(parent_four_momenta[rows], parent_masses[rows], *daughter_masses, rng=rng)
+            else:
+                raise ValueError("Four-body (and above) decays not yet implemented")
+            for slot, (daughter_PID, daughter_four_momenta) in enumerate(zip(decay, daughters)):
+                four_momenta.append(daughter_four_momenta)
+                PIDs.append(np.full(len(rows), daughter_PID))
+                parent_indices.append(rows)
+                daughter_slots.append(np.full(len(rows), slot))
+
+    if len(four_momenta) == 0:
+        return np.zeros((0,4)), np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0)
+    four_momenta, PIDs = np.concatenate(four_momenta), np.concatenate(PIDs)
+    parent_indices, daughter_slots = np.concatenate(parent_indices), np.concatenate(daughter_slots)
+    #order daughters by parent, keeping the daughter order of meson_decay_dict
+    order = np.lexsort((daughter_slots, parent_indices))
+    parent_indices = parent_indices[order]
+    return four_momenta[order], PIDs[order], parent_indices, br_sums[parent_indices]
+
+def decay_mesons(parent_four_momenta, parent_PIDs, parent_weights=None, parent_masses=None, rng=None, cascade=True):
+    """Vectorized version of Particle.decay_particle for many mesons at once
+    Args:
+        parent_four_momenta: (N,4) array of lab-frame meson four-momenta (e.g. a beam file)
+        parent_PIDs: PDG ID of the mesons, either one value or an (N,) array
+        parent_weights: optional (N,) array of meson weights (default: 1)
+        parent_masses: optional (N,) array of meson masses (default: invariant mass of parent_four_momenta)
+        rng: optional numpy random Generator (default: numpy's global random state)
+        cascade: if True, mesons produced in the decays (e.g. eta -> 3 pi0) are decayed in turn,
+            so that only particles absent from meson_decay_dict are returned
+    Returns:
+        daughter_four_momenta: (M,4) array of lab-frame daughter four-momenta
+        daughter_PIDs: (M,) array of daughter PDG IDs
+        parent_indices: (M,) array of the row in parent_four_momenta each daughter descends from
+        daughter_weights: (M,) array of daughter weights (parent weight times the summed branching
+            ratio of every decay along the chain)
+    """
+    parent_four_momenta = np.atleast_2d(np.asarray(parent_four_momenta, dtype=float))
+    n_parents = len(parent_four_momenta)
+    if n_parents == 0:
+        return np.zeros((0,4)), np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0)
+    parent_PIDs = np.broadcast_to(parent_PIDs, (n_parents,))
+    if parent_weights is None:
+        parent_weights = np.ones(n_parents)
+    if parent_masses is None:
+        parent_masses = np.sqrt(np.maximum(parent_four_momenta[:,0]**2 - np.sum(parent_four_momenta[:,1:]**2, axis=1), 0.0))
+    parent_masses = np.broadcast_to(parent_masses, (n_parents,))
+
+    four_momenta, PIDs, origins, weights = [], [], [], []
+    current_origins, current_weights = np.arange(n_parents), np.broadcast_to(np.asarray(parent_weights, dtype=float), (n_parents,))
+    while len(parent_PIDs) > 0:
+        daughter_four_momenta, daughter_PIDs, parent_indices, br_sums = _decay_mesons_once(parent_four_momenta, parent_PIDs, parent_masses, rng=rng)
+        daughter_origins = current_origins[parent_indices]
+        daughter_weights = current_weights[parent_indices]*br_sums
+        if cascade:
+            unstable = np.isin(daughter_PIDs, list(meson_decay_dict.keys()))
+        else:
+            unstable = np.zeros(len(daughter_PIDs), dtype=bool)
+        four_momenta.append(daughter_four_momenta[~unstable])
+        PIDs.append(daughter_PIDs[~unstable])
+        origins.append(daughter_origins[~unstable])
+        weights.append(daughter_weights[~unstable])
+
+        parent_four_momenta, parent_PIDs = daughter_four_momenta[unstable], daughter_PIDs[unstable]
+        parent_masses = np.array([mass_dict[PID] for PID in parent_PIDs])
+        current_origins, current_weights = daughter_origins[unstable], daughter_weights[unstable]
+
+    four_momenta, PIDs = np.concatenate(four_momenta), np.concatenate(PIDs)
+    origins, weights = np.concatenate(origins), np.concatenate(weights)
+    #daughters of each input meson stay together, in the order they were produced
+    order = np.argsort(origins, kind='stable')
+    return four_momenta[order], PIDs[order], origins[order], weights[order]
@@ -0,0 +1,202 @@
+import numpy as np
+from .particle import Particle, default_ids
+
+#Integer codes for the generation_process strings of Particle objects; the SM codes
+#match shower.process_code
+generation_process_codes = {"Input":-1, "Brem":0, "Ann":1, "PairProd":2, "Comp":3, "Moller":4, "Bhabha":5,
+                            "SMDecay":6, "DarkBrem":10, "DarkAnn":11, "DarkComp":12, "TwoBody_BSMDecay":13}
+generation_process_names = {code:name for name, code in generation_process_codes.items()}
+
+stability_codes = {"stable":0, "short-lived":1, "long-lived":2}
+stability_names = {code:name for name, code in stability_codes.items()}
+
+#column name: (trailing shape, dtype)
+#shower IDs double with every generation and can exceed 64 bits, so they are kept as python integers
+table_columns = {"p0":((4,), float), "pf":((4,), float),
+                 "r0":((3,), float), "rf":((3,), float),
+                 "PID":((), np.int64), "ID":((), object),
+                 "parent_PID":((), np.int64), "parent_ID":((), object),
+                 "parent_index":((), np.int64),
+                 "generation_number":((), np.int64),
+                 "process_code":((), np.int64),
+                 "weight":((), float), "split_factor":((), np.int64), "mass":((), float),
+                 "stability_code":((), np.int64),
+                 "ended":((), bool),
+                 "production_time":((), float), "decay_time":((), float), "interaction_time":((), float),
+                 "event_index":((), np.int64)}
+
+class ParticleTable:
+    """Columnar container for the particles of one or more showers
+
+    Each entry of table_columns is stored as a contiguous NumPy array whose first axis
+    runs over particles, e.g. table.pf is an (N,4) array of final four-momenta and
+    table.weight an (N,) array of weights. Columns are returned without copying, so
+    table.rf[:,2] or table["weight"] are views into the table.
+    parent_index is the row (in this table) of the particle's parent, or -1 if the
+    parent is not part of the table. event_index labels the shower each row belongs to.
+    """
+    def __init__(self, **columns):
+        """Initializes a table from arrays given for each entry of table_columns
+        (missing columns are filled with the defaults of default_ids)
+        """
+        lengths = {len(value) for value in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError("All ParticleTable columns must have the same length")
+        n_rows = lengths.pop() if len(lengths) == 1 else 0
+        for name in columns:
+            if name not in table_columns:
+                raise KeyError("Unknown ParticleTable column: " + str(name))
+        for name, (shape, dtype) in table_columns.items():
+            if name in columns:
+                value = np.ascontiguousarray(columns[name], dtype=dtype).reshape((n_rows,) + shape)
+            else:
+                value = np.full((n_rows,) + shape, _column_default(name), dtype=dtype)
+            setattr(self, name, value)
+
+    def __len__(self):
+        return len(self.PID)
+
+    def __getitem__(self, key):
+        """String keys return a column; boolean masks, index arrays and slices return a new ParticleTable"""
+        if isinstance(key, str):
+            return self.get_column(key)
+        return self.select(key)
+
+    def __repr__(self):
+        return "ParticleTable(" + str(len(self)) + " particles, " + str(len(np.unique(self.event_index))) + " events)"
+
+    def get_column(self, name):
+        """Returns the column `name' (a view, not a copy)"""
+        if name not in table_columns:
+            raise KeyError("Unknown ParticleTable column: " + str(name))
+        return getattr(self, name)
+
+    def get_columns(self):
+        """Returns a dictionary of all columns"""
+        return {name:getattr(self, name) for name in table_columns}
+
+    def select(self, selection):
+        """Returns a new ParticleTable containing the rows picked by `selection'
+        (boolean mask, integer index array or slice). parent_index is remapped to the
+        new row numbers; parents not in the selection are set to -1.
+        """
+        rows = np.arange(len(self))[selection]
+        #one extra entry so that parent_index = -1 maps to -1
+        new_row = np.full(len(self) + 1, -1, dtype=np.int64)
+        new_row[rows] = np.arange(len(rows))
+        columns = {name:getattr(self, name)[rows] for name in table_columns}
+        columns["parent_index"] = new_row[columns["parent_index"]]
+        return ParticleTable(**columns)
+
+    def get_generation_process(self):
+        """Returns an array of generation_process strings"""
+        return np.array([generation_process_names[code] for code in self.process_code], dtype=object)
+
+    def get_stability(self):
+        """Returns an array of stability strings"""
+        return np.array([stability_names[code] for code in self.stability_code], dtype=object)
+
+    @classmethod
+    def from_particles(cls, particles, event_index=0):
+        """Builds a table from a list of Particle objects (e.g. the output of generate_shower)
+        Args:
+            particles: list of Particle objects belonging to a single shower
+            event_index: event label stored for all rows
+        Returns:
+            ParticleTable
+        """
+        n_rows = len(particles)
+        if n_rows == 0:
+            return cls()
+        columns = {"p0":[p.get_p0() for p in particles],
+                   "pf":[p.get_pf() for p in particles],
+                   "r0":[p.get_r0() for p in particles],
+                   "rf":[p.get_rf() for p in particles]}
+        for name in ("PID", "ID", "parent_PID", "parent_ID", "generation_number", "weight",
+                     "split_factor", "production_time", "decay_time", "interaction_time", "ended"):
+            columns[name] = [getattr(p, name) for p in particles]
+        columns["mass"] = [np.nan if p.mass is None else p.mass for p in particles]
+        columns["process_code"] = [generation_process_codes[p.generation_process] for p in particles]
+        columns["stability_code"] = [stability_codes[p.stability] for p in particles]
+        columns["event_index"] = np.full(n_rows, event_index)
+        columns["parent_index"] = _parent_indices(columns["ID"], columns["parent_ID"], columns["PID"])
+        return cls(**columns)
+
+    @classmethod
+    def from_showers(cls, showers):
+        """Builds a table from a list of showers (each a list of Particle objects), using the
+        position of each shower in the list as its event_index
+        """
+        return cls.concatenate([cls.from_particles(shower, event_index=ii) for ii, shower in enumerate(showers)],
+                               renumber_events=False)
+
+    @classmethod
+    def concatenate(cls, tables, renumber_events=True):
+        """Concatenates several tables into one
+        Args:
+            tables: list of ParticleTable objects
+            renumber_events: if True, event indices of each table are shifted so that
+                events from different tables remain distinct
+        Returns:
+            ParticleTable
+        """
+        tables = [table for table in tables if len(table) > 0]
+        if len(tables) == 0:
+            return cls()
+        columns = {name:[] for name in table_columns}
+        row_offset, event_offset = 0, 0
+        for table in tables:
+            for name in table_columns:
+                columns[name].append(getattr(table, name))
+            columns["parent_index"][-1] = np.where(table.parent_index >= 0, table.parent_index + row_offset, -1)
+            if renumber_events:
+                columns["event_index"][-1] = table.event_index - np.min(table.event_index) + event_offset
+                event_offset = np.max(columns["event_index"][-1]) + 1
+            row_offset += len(table)
+        return cls(**{name:np.concatenate(columns[name]) for name in table_columns})
+
+    def to_particles(self):
+        """Converts the table back into a list of Particle objects"""
+        particles = []
+        processes, stabilities = self.get_generation_process(), self.get_stability()
+        for ii in range(len(self)):
+            id_dictionary = {"PID":int(self.PID[ii]), "ID":int(self.ID[ii]),
+                             "parent_PID":int(self.parent_PID[ii]), "parent_ID":int(self.parent_ID[ii]),
+                             "generation_number":int(self.generation_number[ii]),
+                             "generation_process":processes[ii], "weight":float(self.weight[ii]),
+                             "split_factor":int(self.split_factor[ii]),
+                             "mass":None if np.isnan(self.mass[ii]) else float(self.mass[ii]),
+                             "stability":stabilities[ii],
+                             "production_time":float(self.production_time[ii]),
+                             "decay_time":float(self.decay_time[ii]),
+                             "interaction_time":float(self.interaction_time[ii])}
+            particle = Particle(self.p0[ii].copy(), self.r0[ii].copy(), id_dictionary)
+            particle.set_pf(self.pf[ii].copy())
+            particle.set_rf(self.rf[ii].copy())
+            particle.set_ended(bool(self.ended[ii]))
+            particles.append(particle)
+        return particles
+
+def _column_default(name):
+    """Value used for a column that is not provided to ParticleTable()"""
+    special_defaults = {"parent_index":-1, "event_index":0, "ended":False, "mass":np.nan,
+                        "process_code":generation_process_codes[default_ids["generation_process"]],
+                        "stability_code":stability_codes[default_ids["stability"]]}
+    if name in special_defaults:
+        return special_defaults[name]
+    return default_ids.get(name, 0.0)
+
+def _parent_indices(IDs, parent_IDs, PIDs):
+    """Finds, for each particle of a single shower, the row of the (SM) particle whose ID
+    matches its parent_ID. Dark vectors share IDs with SM particles, so they are not
+    considered as parents."""
+    IDs, parent_IDs = np.asarray(IDs), np.asarray(parent_IDs)
+    candidate_rows = np.flatnonzero(np.asarray(PIDs) != 4900022)
+    #first occurrence of each ID among the candidate parents
+    candidate_IDs, first = np.unique(IDs[candidate_rows], return_index=True)
+    candidate_rows = candidate_rows[first]
+    if len(candidate_IDs) == 0:
+        return np.full(len(IDs), -1, dtype=np.int64)
+    position = np.clip(np.searchsorted(candidate_IDs, parent_IDs), 0, len(candidate_IDs) - 1)
+    found = candidate_IDs[position] == parent_IDs
+    return np.where(found, candidate_rows[position], -1)
@@ -1,5 +1,5 @@
+import os
 import numpy as np
-from scipy.interpolate import LinearNDInterpolator
 try:
     from .physical_constants import *
 except:
@@ -25,6 +25,19 @@ def boost(p,v):
     
     return np.array(boosted_v)
 
+def boost_batch(p, v):
+    """Array version of boost: boosts each row of v, an (N,4) array, into the rest frame
+    of the corresponding row of p (an (N,4) array or a single four-vector)
+    """
+    p, v = np.broadcast_arrays(np.asarray(p, dtype=float), np.asarray(v, dtype=float))
+    metric = np.array([1.0, -1.0, -1.0, -1.0])
+    rsq = np.sqrt(np.sum(metric*p*p, axis=-1))
+    v0 = np.sum(metric*p*v, axis=-1)/rsq
+    c1 = (v[...,0] + v0)/(rsq + p[...,0])
+    boosted_v = v - c1[...,np.newaxis]*p
+    boosted_v[...,0] = v0
+    return boosted_v
+
 def fl_kf(x,s):
     """
     Kuraev-Fadin lepton structure function from appendix of https://arxiv.org/abs/1607.03210v2
@@ -81,28 +94,71 @@ def transformed_lepton_luminosity_integrand(s,y,u):
 
 
 _lumi_int_fill_val = np.nan
-try:
-    from .lumi_integral_data import *
-except:
-    from lumi_integral_data import *
-log_lumi_integral_list = np.log10(lumi_integral_list+1e-99)
-log_lumi_integral_interp = LinearNDInterpolator(list(zip(log_lumi_integral_list[:,0], log_lumi_integral_list[:,1])),log_lumi_integral_list[:,2], fill_value=_lumi_int_fill_val)
+#Table of the lepton luminosity integral, columns (s, x, value), on a rectilinear grid in (log s, log x)
+_lumi_integral_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lumi_integral_data.npy")
+_log_lumi_integral_interp = None
+
+def load_log_lumi_integral_interp():
+    """Returns the interpolator of log10(lumi integral) in (log10 s, log10 x),
+    reading lumi_integral_data.npy on the first call only
+    """
+    global _log_lumi_integral_interp
+    if _log_lumi_integral_interp is None:
+        from scipy.interpolate import RegularGridInterpolator
+        lumi_integral_list = np.load(_lumi_integral_file)
+        lumi_integral_list = lumi_integral_list[np.lexsort((lumi_integral_list[:,1], lumi_integral_list[:,0]))]
+        log_s_grid, log_x_grid = np.unique(np.log10(lumi_integral_list[:,0])), np.unique(np.log10(lumi_integral_list[:,1]))
+        log_lumi_integral_grid = np.log10(lumi_integral_list[:,2]+1e-99).reshape(len(log_s_grid), len(log_x_grid))
+        _log_lumi_integral_interp = RegularGridInterpolator((log_s_grid, log_x_grid), log_lumi_integral_grid,
+                                                            bounds_error=False, fill_value=_lumi_int_fill_val)
+    return _log_lumi_integral_interp
 
 def lumi_integral_interp(s, x):
-    ll = log_lumi_integral_interp(np.log10(s), np.log10(x))
-    if ll == _lumi_int_fill_val:
-        return 0.
-    else:
-        return np.power(10, log_lumi_integral_interp(np.log10(s), np.log10(x)))
+    """Lepton luminosity integral at Mandelstam s and x = mV^2/s, interpolated from lumi_integral_data.npy
+    Args:
+        s, x: scalars or arrays (broadcast against each other)
+    Returns:
+        lumi integral with the broadcast shape of s and x; zero outside the tabulated range
+    """
+    s, x = np.broadcast_arrays(np.asarray(s, dtype=float), np.asarray(x, dtype=float))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ll = load_log_lumi_integral_interp()((np.log10(s), np.log10(x)))
+    lumi_integral = np.zeros(np.shape(ll))
+    in_range = ~np.isnan(ll)
+    lumi_integral[in_range] = np.power(10, ll[in_range])
+    return lumi_integral[()]
 
 def radiative_return_cross_section(s, mA):
+    """Radiative return cross section e+ e- -> A' (for eps = 1) in pb
+    Args:
+        s, mA: scalars or arrays (broadcast against each other)
+    Returns:
+        cross section with the broadcast shape of s and mA; zero below threshold (s < mA^2 or mA < 2 m_e)
+    """
+    s, mA = np.asarray(s, dtype=float), np.asarray(mA, dtype=float)
     eps = 1.
-    betaf = np.sqrt( 1. - 4.*(m_electron**2) / (mA**2) )
+    betaf = np.sqrt(np.maximum(1. - 4.*(m_electron**2) / (mA**2), 0.))
     
     # this factor should be equal to 12pi^2 Gamma(A'->ee)/(mA * s)
     prefac = (4.*np.pi**2)*(alpha_em*eps**2)*betaf*(3./2. - betaf**2 / 2.)/s
     
     lumi_factor = lumi_integral_interp(s, mA**2 / s)
-
     return prefac*lumi_factor*3.89379e+08 # 1/GeV^2 -> pb
-    
+
+_radiative_return_cross_section_tables = {}
+def radiative_return_cross_section_table(s_values, mA_values):
+    """Tabulates radiative_return_cross_section for every pair of s in s_values and mA in mA_values
+    Tables are cached, so repeated calls with the same lists (e.g. one per target material) are free.
+    Args:
+        s_values: list/array of Mandelstam s, e.g. 2 m_e (E_inc + m_e) for positron energies E_inc
+        mA_values: list/array of vector masses
+    Returns:
+        read-only (len(mA_values), len(s_values)) array of cross sections in pb
+    """
+    s_values, mA_values = np.asarray(s_values, dtype=float).ravel(), np.asarray(mA_values, dtype=float).ravel()
+    key = (tuple(s_values), tuple(mA_values))
+    if key not in _radiative_return_cross_section_tables:
+        table = radiative_return_cross_section(s_values[np.newaxis,:], mA_values[:,np.newaxis])
+        table.setflags(write=False)
+        _radiative_return_cross_section_tables[key] = table
+    return _radiative_return_cross_section_tables[key]
@@ -1,11 +1,9 @@
-import numpy as npA
+import numpy as np
 import pickle 
 
-from scipy.interpolate import interp1d
-from scipy.integrate import quad
-
 from .moliere import get_scattered_momentum_fast, get_scattered_momentum_Bethe
 from .particle import Particle
+from .particle_table import ParticleTable
 from .kinematics import e_to_egamma_fourvecs, gamma_to_epem_fourvecs, compton_fourvecs, annihilation_fourvecs, ee_to_ee_fourvecs
 from .all_processes import *
 from .physical_constants import *
@@ -211,6 +209,9 @@ class Shower:
         """Constructs interpolations of n_T sigma (in 1/cm) as a functon of 
         incoming particle energy for each process
         """
+        from scipy.interpolate import interp1d
+        from scipy.integrate import quad
+
         BS, PPS, AnnS, CS, MS, BhS = self.get_brem_cross_section(), self.get_pairprod_cross_section(), self.get_annihilation_cross_section(), self.get_compton_cross_section(), self.get_moller_cross_section(), self.get_bhabha_cross_section()
         nZ, ne = self.get_n_targets()
         self._NSigmaBrem = interp1d(np.transpose(BS)[0], nZ*GeVsqcm2*np.transpose(BS)[1], fill_value=0.0, bounds_error=False)
@@ -276,7 +277,7 @@ class Shower:
         if type(particle) is not Particle and (type(particle) is list or type(particle) is np.ndarray):
             PID, Energy = particle
         else:
-            PID, Energy = particle.get_ids()["PID"], particle.get_pf()[0]
+            PID, Energy = particle.PID, particle.get_pf()[0]
         if PID == 22:
             return cmtom*(self._NSigmaPP(Energy) + self._NSigmaComp(Energy))**-1
         elif PID == 11:
@@ -326,6 +327,7 @@ class Shower:
         adaptive_map = sample_dict["adaptive_map"]
         max_F      = sample_dict["max_F"][self._target_material]*self._maxF_fudge_global
         neval_vegas= sample_dict["neval"]
+        import vegas as vg
         integrand=vg.Integrator(map=adaptive_map, max_nhcube=1, neval=neval_vegas)
 
         event_info={'E_inc': Einc, 'm_e': m_electron, 'Z_T': self._ZTarget, 'A_T':self._ATarget, 'mT':self._ATarget, 'alpha_FS': alpha_em, 'mV': 0, 'Eg_min':self._Egamma_min, 'Ee_min':self.min_energy}
@@ -347,11 +349,17 @@ class Shower:
         sample_found = False
         while sample_found is False and n_integrators_used < self._max_n_integrators:
             n_integrators_used += 1
-            for x,wgt in integrand.random():
-                if VB:
-                    sampcount += 1  
-                if  max_F*draw_U()<wgt*diff_xsec_func(event_info,x):
-                    sample_found = True
+            for x_batch, wgt_batch in integrand.random_batch():
+                # VEGAS returns the points of a batch ordered by hypercube, so they are tried in random 
+                # order: otherwise the first accepted point is biased towards the first hypercubes
+                for ii in np.random.permutation(len(wgt_batch)):
+                    if VB:
+                        sampcount += 1  
+                    if  max_F*draw_U()<wgt_batch[ii]*diff_xsec_func(event_info,x_batch[ii]):
+                        x = np.array(x_batch[ii])
+                        sample_found = True
+                        break
+                if sample_found:
                     break
         if sample_found is False:
             raise Exception("No Sample Found", process, Einc, LU_Key)
@@ -362,7 +370,7 @@ class Shower:
     
     def sample_scattering(self, p0, process, VB=False):
         E0 = p0.get_pf()[0]
-        if E0 <= np.max([self._minimum_calculable_energy[p0.get_ids()["PID"]], self.min_energy, p0.get_ids()["mass"]]):
+        if E0 <= np.max([self._minimum_calculable_energy[p0.PID], self.min_energy, p0.mass]):
             return None
         RM = p0.rotation_matrix()
         sample_event = self.draw_sample(E0, process=process, VB=VB)
@@ -375,24 +383,23 @@ class Shower:
         p1_labframe = np.concatenate([[E1f], np.dot(RM, [p1xZF, p1yZF, p1zZF])])
         p2_labframe = np.concatenate([[E2f], np.dot(RM, [p2xZF, p2yZF, p2zZF])])
 
-        init_IDs = p0.get_ids()
         p1_dict = {}
         p1_dict["PID"] = process_PIDS[process][0]
-        p1_dict["parent_PID"] = init_IDs["PID"]
-        p1_dict["ID"] = 2*(init_IDs["ID"]) + 0
-        p1_dict["parent_ID"] = init_IDs["ID"]
-        p1_dict["generation_number"] = init_IDs["generation_number"] + 1
+        p1_dict["parent_PID"] = p0.PID
+        p1_dict["ID"] = 2*(p0.ID) + 0
+        p1_dict["parent_ID"] = p0.ID
+        p1_dict["generation_number"] = p0.generation_number + 1
         p1_dict["generation_process"] = process
-        p1_dict["weight"] = init_IDs["weight"]
+        p1_dict["weight"] = p0.weight
 
         p2_dict = p1_dict.copy()
         p2_dict["PID"] = process_PIDS[process][1]
-        p2_dict["ID"] = 2*(init_IDs["ID"]) + 1
+        p2_dict["ID"] = 2*(p0.ID) + 1
 
         if p1_dict["PID"] == 0:
-            p1_dict["PID"] = init_IDs["PID"]
+            p1_dict["PID"] = p0.PID
         if p2_dict["PID"] == 0:
-            p2_dict["PID"] = init_IDs["PID"]
+            p2_dict["PID"] = p0.PID
 
         new_particle1 = Particle(p1_labframe, p0.get_rf(), p1_dict)
         new_particle2 = Particle(p2_labframe, p0.get_rf(), p2_dict)
@@ -422,8 +429,8 @@ class Shower:
                 raise ValueError("propagate_particle() should only be called \
                 for a particle with pf = p0 and rf = r0 and get_ended() == False")
 
-            particle_min_energy = np.max([self._minimum_calculable_energy[Part0.get_ids()["PID"]],\
-                                          self.min_energy, Part0.get_ids()["mass"]])
+            particle_min_energy = np.max([self._minimum_calculable_energy[Part0.PID],\
+                                          self.min_energy, Part0.mass])
             if Part0.get_p0()[0] < particle_min_energy:
                 Part0.set_ended(True)
                 return Part0
@@ -498,16 +505,17 @@ class Shower:
             Part0.set_ended(True)
             return Part0
 
-    def generate_shower(self, p0, VB=False, GlobalMS=True):
+    def generate_shower(self, p0, VB=False, GlobalMS=True, return_table=False):
         """
         Generates particle shower from an initial particle
         Args:
             p0: initial Particle 
             VB: bool to turn on/off verbose output
             GlobalMS: bool, multiple scattering flag. Set to false to disable multiple scattering of electrons and positrons
+            return_table: bool, if True the shower is returned as a ParticleTable
 
         Returns:
-            AllParticles: a list of all particles generated in the shower
+            AllParticles: a list of all particles generated in the shower (or a ParticleTable if return_table is True)
         """
         if VB:
             print("Starting shower, initial particle with ID Info")
@@ -515,7 +523,8 @@ class Shower:
             print("Initial four-momenta:")
             print(p0.get_p0())
         p0.set_ended(False)
-        p0copy = copy.deepcopy(p0)
+        #particles are never modified in place (only through their setters), so a shallow copy suffices
+        p0copy = copy.copy(p0)
         all_particles = [p0copy]
 
         if GlobalMS==True:
@@ -527,6 +536,8 @@ class Shower:
 
         if p0.get_p0()[0] < self.min_energy:
             p0.set_ended(True)
+            if return_table:
+                return ParticleTable.from_particles(all_particles)
             return all_particles
 
         while all([ap.get_ended() == True for ap in all_particles]) is False:
@@ -536,14 +547,14 @@ class Shower:
                 else:
                     newparticles = None
 
-                    if ap.get_ids()["stability"] == "short-lived":
+                    if ap.stability == "short-lived":
                         newparticles = ap.decay_particle()
                     
-                    elif ap.get_ids()["stability"] == "stable":
+                    elif ap.stability == "stable":
                         # Propagate particle until next hard interaction
-                        if ap.get_ids()["PID"] == 22:
+                        if ap.PID == 22:
                             ap = self.propagate_particle(ap,MS=MS_g)
-                        elif np.abs(ap.get_ids()["PID"]) == 11:
+                        elif np.abs(ap.PID) == 11:
                             dEdxT = self.get_material_properties()[3]*(0.1) #Converting MeV/cm to GeV/m
                             ap = self.propagate_particle(ap, MS=MS_e, Losses=dEdxT)
                         
@@ -558,7 +569,7 @@ class Shower:
                         # Generate secondaries for the hard interaction
                         # Note: secondaries include the scattered parent particle 
                         # (i.e. the original the parent is not modified)
-                        if ap.get_ids()["PID"] == 11:
+                        if ap.PID == 11:
                             choices0 = self._NSigmaBrem(ap.get_pf()[0]), self._NSigmaMoller(ap.get_pf()[0])
                             SC = np.sum(choices0)
                             if SC == 0.0 or np.isnan(SC):
@@ -566,7 +577,7 @@ class Shower:
                             choices0 = choices0/SC
                             draw = np.random.choice(["Brem","Moller"], p=choices0)
                             newparticles = self.sample_scattering(ap, process=draw, VB=VB)
-                        elif ap.get_ids()["PID"] == -11:
+                        elif ap.PID == -11:
                             choices0 = self._NSigmaBrem(ap.get_pf()[0]), \
                                 self._NSigmaAnn(ap.get_pf()[0]), self._NSigmaBhabha(ap.get_pf()[0])
                             SC = np.sum(choices0)
@@ -576,7 +587,7 @@ class Shower:
                             draw = np.random.choice(["Brem","Ann","Bhabha"], p=choices0)
                             newparticles = self.sample_scattering(ap, process=draw, VB=VB)
 
-                        elif ap.get_ids()["PID"] == 22:
+                        elif ap.PID == 22:
                             choices0 = self._NSigmaPP(ap.get_pf()[0]), self._NSigmaComp(ap.get_pf()[0])
                             SC = np.sum(choices0)
                             if SC == 0.0 or np.isnan(SC):
@@ -590,7 +601,9 @@ class Shower:
                     for dp in newparticles:
                         if dp.get_p0()[0] > self.min_energy:
                             all_particles.append(dp)
-                    
+
+        if return_table:
+            return ParticleTable.from_particles(all_particles)
         return all_particles
 
 def event_display(all_particles):
@@ -713,7 +726,11 @@ def detector_cut(particle_list, detector_positions, detector_radius, method="Sam
                 -- "TotalWeight": returns the total weight of particles passing through the detector
             -- energy_cut: tuple of minimum and maximum energies of particles to consider
             -- detector_inner_radius: inner radius of the detector
+        particle_list may also be a ParticleTable, in which case "Sample" returns a list of ParticleTables
     '''
+    if type(particle_list) is ParticleTable:
+        return _detector_cut_table(particle_list, detector_positions, detector_radius, method, energy_cut, detector_inner_radius)
+
     particle_list = np.array(particle_list)
 
     if energy_cut is not None:
@@ -735,6 +752,35 @@ def detector_cut(particle_list, detector_positions, detector_radius, method="Sam
     if method == "Sample":
         return pass_cuts
     elif method == "Efficiency":
-        return [np.sum([p0.get_ids()["weight"] for p0 in pass_cuts[ii]])/np.sum([p0.get_ids()["weight"] for p0 in particle_list]) for ii in range(len(pass_cuts))]
+        return [np.sum([p0.weight for p0 in pass_cuts[ii]])/np.sum([p0.weight for p0 in particle_list]) for ii in range(len(pass_cuts))]
+    elif method == "TotalWeight":
+        return [np.sum([p0.weight for p0 in pass_cuts[ii]]) for ii in range(len(pass_cuts))]
+
+def _detector_cut_table(particle_table, detector_positions, detector_radius, method, energy_cut, detector_inner_radius):
+    '''Vectorized version of detector_cut for a ParticleTable'''
+    if energy_cut is not None:
+        energies = particle_table.p0[:,0]
+        particle_table = particle_table[(energies < energy_cut[1])*(energies > energy_cut[0])]
+
+    if len(particle_table) == 0:
+        if method == "Sample":
+            return [particle_table for i in range(len(detector_positions))]
+        else:
+            return [0.0 for i in range(len(detector_positions))]
+
+    # transverse positions of every particle at every detector position, shape (n_particles, n_detectors)
+    z = np.atleast_1d(detector_positions)
+    x0, y0, z0 = np.transpose(particle_table.r0)
+    E, px, py, pz = np.transpose(particle_table.p0)
+    T = (z[np.newaxis,:] - z0[:,np.newaxis])/pz[:,np.newaxis]
+    rT = np.sqrt((x0[:,np.newaxis] + T*px[:,np.newaxis])**2 + (y0[:,np.newaxis] + T*py[:,np.newaxis])**2)
+
+    pass_cuts_where = np.transpose((rT > detector_inner_radius)*(rT < detector_radius))
+    weights = particle_table.weight
+
+    if method == "Sample":
+        return [particle_table[pass_cuts_where[ii]] for ii in range(len(pass_cuts_where))]
+    elif method == "Efficiency":
+        return [np.sum(weights[pass_cuts_where[ii]])/np.sum(weights) for ii in range(len(pass_cuts_where))]
     elif method == "TotalWeight":
-        return [np.sum([p0.get_ids()["weight"] for p0 in pass_cuts[ii]]) for ii in range(len(pass_cuts))]
\ No newline at end of file
+        return [np.sum(weights[pass_cuts_where[ii]]) for ii in range(len(pass_cuts_where))]
@@ -0,0 +1,25 @@
+import numpy as np
+
+from PETITE import particle
+from PETITE.particle import Particle
+from PETITE.particle_table import ParticleTable
+
+
+def test_three_body_cascade_ids_are_unique(monkeypatch):
+    # only keep eta -> 3 pi0, so that the cascade eta -> 3 pi0 -> 6 gamma is exercised every time
+    monkeypatch.setitem(particle.meson_decay_dict, 221, [[particle.meson_decay_dict[221][1][0], [111, 111, 111]]])
+    eta = Particle([10.0, 0.0, 0.0, np.sqrt(10.0**2 - particle.mass_dict[221]**2)], [0.0, 0.0, 0.0],
+                   {"PID":221, "ID":1, "mass":particle.mass_dict[221], "stability":"short-lived"})
+    shower, pending = [eta], [eta]
+    while len(pending) > 0:
+        daughters = pending.pop().decay_particle()
+        shower.extend(daughters)
+        pending.extend([daughter for daughter in daughters if daughter.stability == "short-lived"])
+
+    assert sorted([p.PID for p in shower]) == [22]*6 + [111]*3 + [221]
+    IDs = [p.ID for p in shower]
+    assert len(set(IDs)) == len(IDs)
+
+    table = ParticleTable.from_particles(shower)
+    pions = np.flatnonzero(table.PID == 111)
+    assert np.all(table.parent_index[pions] == 0)
@@ -0,0 +1,251 @@
+""" Choose the incoming energies at which VEGAS integrators are trained for a process.
+
+    Starts from a coarse log-spaced grid and repeatedly bisects (in log energy) the intervals where
+    neighbouring nodes do not describe the energies in between well enough:
+     - cross section: the shower interpolates cross sections linearly between nodes, so the interpolated
+       cross section at the midpoint is compared with the one computed there
+     - sampling: the shower samples at any energy with the adaptive map and max_F of the closest node, so the
+       fraction of the integrand that lies above max_F of either neighbouring node (and is therefore cut off
+       when unweighting) is computed where the shower switches from one node to the other
+    Intervals are refined until both are below tolerance, the interval is narrower than min_ratio, or the
+    number of nodes reaches max_nodes. The result is a non-uniform energy grid and an error report for each
+    interval; the integrators trained at the final nodes can be saved so that they need not be trained again.
+
+    Typical usage:
+
+    python adaptive_energy_grid.py -process=Comp -min_energy=0.01 -max_energy=100 -process_targets graphite lead
+"""
+import os
+import argparse
+import pickle
+import numpy as np
+from functools import partial
+from multiprocessing import Pool
+import vegas
+
+from PETITE.all_processes import *
+from PETITE.physical_constants import *
+from generate_integrators import prepare_training_params, make_readme, write_atomically
+
+def train_node(task):
+    """ Train the VEGAS integrator of a process at one energy (see generate_integrators.run_vegas_in_parallel).
+    Input:
+        task: tuple (params, process, energy) with params prepared by prepare_training_params
+    Output:
+        event_info used for training (including the defaults set by vegas_integration) and the adaptive map
+    """
+    params, process, energy = task
+    event_info = dict(params, E_inc=energy)
+    integrator = vegas_integration(event_info, process, verbose=params.get('verbosity', False), mode='Pickle',
+                                   batch=params.get('batch_integrands', True))
+    return(event_info, integrator.map)
+
+def scan_integrand(params, process, event_info, adaptive_map, max_F=None):
+    """ Sample the integrand (VEGAS weight times cross section) with a given adaptive map, as find_maxes does.
+    All scans use the same seed, so differences between energies are not dominated by sampling noise.
+    Input:
+        params: dictionary with 'process_targets', 'neval', 'n_trials', 'seed' (and 'mV' for dark processes)
+        process: string of process name
+        event_info: event information at the energy to scan
+        adaptive_map: adaptive map to sample with (not necessarily trained at this energy)
+        max_F: optional dictionary {target: max_F} of a neighbouring node, for which the overflow is computed
+    Output:
+        dictionary {target: {'xsec', 'xsec_error', 'max_F', 'overflow'}} where overflow is the fraction of
+        the cross section above max_F (None if max_F is not given)
+    """
+    integrand = vegas.Integrator(map=adaptive_map, **vegas_integrator_options[process])
+    integrand.set(max_nhcube=1, neval=params['neval'], ran_array_generator=np.random.default_rng(params['seed']).random)
+    diff_xsec = diff_xsection_batch_options[process]
+
+    event_info_TM = {}
+    for tm in params['process_targets']:
+        event_info_TM[tm] = dict(event_info, Z_T=target_information[tm]['Z_T'], A_T=target_information[tm]['A_T'], mT=target_information[tm]['mT'])
+        if 'mV' in params:
+            event_info_TM[tm]['mV'] = params['mV']
+    trial_xsec = {tm:np.zeros(params['n_trials']) for tm in params['process_targets']}
+    scan = {tm:{'max_F':0.0, 'overflow':0.0} for tm in params['process_targets']}
+    for trial_number in range(params['n_trials']):
+        for x, wgt in integrand.random_batch():
+            for tm in params['process_targets']:
+                MM = wgt*diff_xsec(event_info_TM[tm], x)
+                trial_xsec[tm][trial_number] += np.sum(MM)
+                scan[tm]['max_F'] = max(scan[tm]['max_F'], np.max(MM))
+                if max_F is not None:
+                    scan[tm]['overflow'] += np.sum(np.clip(MM - max_F[tm], 0.0, None))
+    for tm in params['process_targets']:
+        scan[tm]['xsec'] = np.mean(trial_xsec[tm])
+        scan[tm]['xsec_error'] = np.std(trial_xsec[tm])/np.sqrt(params['n_trials'])
+        if max_F is None:
+            scan[tm]['overflow'] = None
+        elif scan[tm]['xsec'] > 0:
+            scan[tm]['overflow'] = scan[tm]['overflow']/params['n_trials']/scan[tm]['xsec']
+    return(scan)
+
+def interval_errors(params, process, lower, upper, midpoint):
+    """ Errors made inside an interval when it is described by its two end nodes.
+    Input:
+        lower, upper, midpoint: nodes, i.e. dictionaries with 'energy', 'event_info', 'adaptive_map' and 'scan'
+    Output:
+        dictionary with the largest (over targets) 'xsec_error' (relative error of the linearly interpolated
+        cross section at the midpoint), 'sampling_error' (overflow above max_F of the end nodes halfway between
+        them, where the closest node changes) and 'mc_error' (relative Monte Carlo uncertainty of the midpoint cross section)
+    """
+    errors = {'xsec_error':0.0, 'sampling_error':0.0, 'mc_error':0.0}
+    fraction = (midpoint['energy'] - lower['energy'])/(upper['energy'] - lower['energy'])
+    for tm in params['process_targets']:
+        xsec = midpoint['scan'][tm]['xsec']
+        interpolated_xsec = (1 - fraction)*lower['scan'][tm]['xsec'] + fraction*upper['scan'][tm]['xsec']
+        if xsec > 0:
+            errors['xsec_error'] = max(errors['xsec_error'], np.abs(interpolated_xsec - xsec)/xsec)
+            errors['mc_error'] = max(errors['mc_error'], midpoint['scan'][tm]['xsec_error']/xsec)
+        elif interpolated_xsec > 0:
+            errors['xsec_error'] = np.inf
+    switching_event_info = dict(midpoint['event_info'], E_inc=(lower['energy'] + upper['energy'])/2)
+    for node in [lower, upper]:
+        scan = scan_integrand(params, process, switching_event_info, node['adaptive_map'],
+                              max_F={tm:node['scan'][tm]['max_F'] for tm in params['process_targets']})
+        for tm in params['process_targets']:
+            if scan[tm]['overflow'] is not None:
+                errors['sampling_error'] = max(errors['sampling_error'], scan[tm]['overflow'])
+    return(errors)
+
+def make_nodes(params, process, energies, pool):
+    """ Train and scan the integrators at a list of energies
+    Output:
+        list of nodes (dictionaries with 'energy', 'event_info', 'adaptive_map' and 'scan')
+    """
+    nodes = []
+    for energy, (event_info, adaptive_map) in zip(energies, pool.map(train_node, [(params, process, energy) for energy in energies], chunksize=1)):
+        nodes.append({'energy':energy, 'event_info':event_info, 'adaptive_map':adaptive_map,
+                      'scan':scan_integrand(params, process, event_info, adaptive_map)})
+    return(nodes)
+
+def adaptive_energy_grid(params, process):
+    """ Build a non-uniform energy grid for a process by refining a coarse log-spaced grid.
+    Input:
+        params: dictionary of parameters containing
+            min_energy, max_energy : energy range in GeV
+            n_initial : number of nodes of the initial log-spaced grid
+            xsec_tol : tolerance on the relative error of the interpolated cross section
+            sampling_tol : tolerance on the fraction of the integrand above max_F of the neighbouring nodes
+            min_ratio : intervals with E_upper/E_lower below this are not refined further
+            max_nodes : maximum number of nodes
+            process_targets : target materials on which the errors are evaluated
+            neval, n_trials, seed : VEGAS sampling parameters (as for find_maxes)
+            n_processes : number of worker processes used to train integrators (default: all cores)
+            mV, training_target : for dark processes, as for generate_integrators.make_integrators
+        process: string of process name
+    Output:
+        nodes: list of nodes (dictionaries with 'energy', 'event_info', 'adaptive_map' and 'scan'), sorted in energy
+        report: list of dictionaries, one per interval, with 'lower_energy', 'upper_energy', 'xsec_error',
+            'sampling_error', 'mc_error' and 'status' ('converged', 'min_ratio', 'max_nodes' or 'untested')
+    """
+    training_params = dict(params)
+    prepare_training_params(training_params, process)
+    energies = np.logspace(np.log10(params['min_energy']), np.log10(params['max_energy']), params['n_initial'])
+
+    with Pool(processes=params.get('n_processes', None)) as pool:
+        nodes = make_nodes(training_params, process, energies, pool)
+        # intervals (pairs of nodes) still to be tested, and the report of intervals that are final
+        to_test = list(zip(nodes[:-1], nodes[1:]))
+        report = []
+        while len(to_test) > 0:
+            too_narrow = [interval for interval in to_test if interval[1]['energy']/interval[0]['energy'] < params['min_ratio']]
+            to_test = [interval for interval in to_test if interval[1]['energy']/interval[0]['energy'] >= params['min_ratio']]
+            report += [dict(lower_energy=lower['energy'], upper_energy=upper['energy'], xsec_error=np.nan, sampling_error=np.nan,
+                            mc_error=np.nan, status='min_ratio') for lower, upper in too_narrow]
+            if len(to_test) == 0:
+                break
+            print("Testing " + str(len(to_test)) + " intervals, " + str(len(nodes)) + " nodes so far")
+            midpoints = make_nodes(training_params, process, [np.sqrt(lower['energy']*upper['energy']) for lower, upper in to_test], pool)
+
+            to_refine = []
+            for (lower, upper), midpoint in zip(to_test, midpoints):
+                errors = interval_errors(training_params, process, lower, upper, midpoint)
+                if errors['xsec_error'] > params['xsec_tol'] or errors['sampling_error'] > params['sampling_tol']:
+                    to_refine.append((max(errors['xsec_error']/params['xsec_tol'], errors['sampling_error']/params['sampling_tol']), lower, upper, midpoint, errors))
+                else:
+                    report.append(dict(lower_energy=lower['energy'], upper_energy=upper['energy'], status='converged', **errors))
+
+            # worst intervals first, as long as nodes can be added
+            to_refine.sort(key=lambda refinement: -refinement[0])
+            to_test = []
+            for ratio, lower, upper, midpoint, errors in to_refine:
+                if len(nodes) < params['max_nodes']:
+                    nodes.append(midpoint)
+                    to_test += [(lower, midpoint), (midpoint, upper)]
+                else:
+                    report.append(dict(lower_energy=lower['energy'], upper_energy=upper['energy'], status='max_nodes', **errors))
+            if len(nodes) >= params['max_nodes']:
+                report += [dict(lower_energy=lower['energy'], upper_energy=upper['energy'], xsec_error=np.nan, sampling_error=np.nan,
+                                mc_error=np.nan, status='untested') for lower, upper in to_test]
+                break
+
+    nodes.sort(key=lambda node: node['energy'])
+    report.sort(key=lambda interval: interval['lower_energy'])
+    return(nodes, report)
+
+def write_report(report, file_name, params, process):
+    """ Write the error report of adaptive_energy_grid to a text file"""
+    lines = ["Adaptive energy grid for " + process + (" (mV = " + str(params['mV']) + " GeV)" if 'mV' in params else ""),
+             "Tolerances: cross section " + str(params['xsec_tol']) + ", sampling " + str(params['sampling_tol']) + ", targets " + ", ".join(params['process_targets']),
+             str(len(report) + 1) + " nodes\n",
+             "E_lower/GeV |  E_upper/GeV |  xsec error |  sampling error |  MC error |  status"]
+    for interval in report:
+        lines.append("{lower_energy:11.5g} | {upper_energy:12.5g} | {xsec_error:11.3g} | {sampling_error:15.3g} | {mc_error:9.3g} |  {status}".format(**interval))
+    write_atomically(file_name, lambda f: f.write(("\n".join(lines) + "\n").encode()))
+
+def save_integrators(nodes, params, process):
+    """ Save the integrators trained at the final nodes as generate_integrators does, so that they can be stitched
+    (or picked up by generate_integrators.run_training_pipeline) without training them again"""
+    training_params = dict(params, initial_energy_list=np.array([node['energy'] for node in nodes]))
+    process_directory = prepare_training_params(training_params, process)
+    os.makedirs(process_directory, exist_ok=True)
+    for energy_index, node in enumerate(nodes):
+        object_to_save = [dict(node['event_info'], initial_energy_list=training_params['initial_energy_list'], process=process), node['adaptive_map']]
+        write_atomically(process_directory + process + '_' + str(energy_index) + ".p", partial(pickle.dump, object_to_save))
+    make_readme(training_params, process, process_directory)
+    return(process_directory)
+
+def main(params, process):
+    nodes, report = adaptive_energy_grid(params, process)
+    grid = np.array([node['energy'] for node in nodes])
+    name = process + ('_mV_' + str(int(np.floor(params['mV']*1000.))) + "MeV" if 'mV' in params else "")
+    os.makedirs(params['save_location'], exist_ok=True)
+    write_atomically(os.path.join(params['save_location'], name + "_energy_grid.npy"), partial(np.save, arr=grid))
+    write_report(report, os.path.join(params['save_location'], name + "_energy_grid_report.txt"), params, process)
+    print(str(len(grid)) + " nodes, saved to " + os.path.join(params['save_location'], name + "_energy_grid.npy"))
+    print("Intervals not converged: " + str(sum([interval['status'] != 'converged' for interval in report])))
+    if params['save_integrators']:
+        print("Integrators saved in " + save_integrators(nodes, params, process))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Choose a non-uniform energy grid for the VEGAS integrators of a process', formatter_class = argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-process', type=str, required=True, help='process (choose from "PairProd", "Brem", "DarkBrem", "Comp", "Ann", "Moller", "Bhabha", "DarkAnn", "DarkComp")')
+    parser.add_argument('-mV', type=float, default=None, help='dark vector mass in GeV (dark processes only)')
+    parser.add_argument('-training_target', type=str, default='hydrogen', help='target on which to train (dark processes only)')
+    parser.add_argument('-process_targets', nargs='+', type=str, default=['graphite', 'lead'], help='targets on which the errors are evaluated')
+    parser.add_argument('-min_energy', type=float, default=0.01, help='minimum energy (in GeV)')
+    parser.add_argument('-max_energy', type=float, default=100., help='maximum energy (in GeV)')
+    parser.add_argument('-n_initial', type=int, default=9, help='number of nodes of the initial log-spaced grid')
+    parser.add_argument('-xsec_tol', type=float, default=0.01, help='tolerance on the relative error of the interpolated cross section')
+    parser.add_argument('-sampling_tol', type=float, default=0.01, help='tolerance on the fraction of the integrand above max_F of the neighbouring nodes')
+    parser.add_argument('-min_ratio', type=float, default=1.02, help='minimum ratio of the energies of neighbouring nodes')
+    parser.add_argument('-max_nodes', type=int, default=100, help='maximum number of nodes')
+    parser.add_argument('-neval', type=int, default=300, help='neval used to sample the integrators (as for find_maxes)')
+    parser.add_argument('-n_trials', type=int, default=20, help='number of samples used to estimate cross sections and max_F')
+    parser.add_argument('-seed', type=int, default=0, help='seed for the VEGAS random numbers of the scans')
+    parser.add_argument('-n_processes', type=int, default=None, help='number of worker processes (default: all available cores)')
+    parser.add_argument('-save_location', type=str, default='../data/', help='directory in which the grid, report and integrators are saved')
+    parser.add_argument('-save_integrators', action='store_true', help='save the integrators trained at the final nodes in save_location/<process>/')
+    parser.add_argument('-verbosity', action='store_true', help='verbosity mode')
+
+    args = parser.parse_args()
+    params = {'min_energy':args.min_energy, 'max_energy':args.max_energy, 'n_initial':args.n_initial,
+              'xsec_tol':args.xsec_tol, 'sampling_tol':args.sampling_tol, 'min_ratio':args.min_ratio, 'max_nodes':args.max_nodes,
+              'process_targets':args.process_targets, 'neval':args.neval, 'n_trials':args.n_trials, 'seed':args.seed,
+              'n_processes':args.n_processes, 'save_location':args.save_location, 'save_integrators':args.save_integrators,
+              'verbosity':args.verbosity}
+    if args.mV is not None:
+        params.update({'mV':args.mV, 'training_target':args.training_target})
+    main(params, args.process)
@@ -0,0 +1,23 @@
+""" Add target materials to existing processed integrators (sm_maps.pkl, sm_xsec.pkl, dark_maps.pkl, dark_xsec.pkl)
+    without retraining the adaptive maps, see find_maxes.add_targets.
+    New materials must first be added to target_information in physical_constants.py.
+
+    Typical usage:
+
+    python add_targets.py -targets tungsten molybdenum -save_location=../data/
+"""
+import argparse
+import find_maxes
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Add target materials to processed integrators', formatter_class = argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-targets', nargs='+', type=str, required=True, help='target materials to add (keys of target_information)')
+    parser.add_argument('-save_location', type=str, default='../data/', help='directory containing the maps and cross section tables')
+    parser.add_argument('-n_trials', type=int, default=100, help='number of evaluations to perform for estimating cross-section')
+    parser.add_argument('-overwrite', action='store_true', help='recompute targets that are already in the tables')
+    parser.add_argument('-n_processes', type=int, default=None, help='number of worker processes (default: all available cores, 1 runs serially)')
+    parser.add_argument('-seed', type=int, default=0, help='base seed for the VEGAS random numbers of each (mV, process, energy) task')
+
+    args = parser.parse_args()
+    find_maxes.add_targets({'new_targets':args.targets, 'save_location':args.save_location, 'n_trials':args.n_trials,
+                            'overwrite':args.overwrite, 'n_processes':args.n_processes, 'seed':args.seed})
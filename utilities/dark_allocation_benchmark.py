@@ -0,0 +1,79 @@
+""" Measure the time and memory allocated per SM particle when producing dark vectors.
+
+    produce_bsm_particle applies the energy loss and multiple scattering of the SM particle
+    to a new four-momentum instead of deep-copying and modifying the particle. This script
+    generates an SM shower and compares, for every (particle, process) pair with a non-zero weight,
+    the memory allocated (peak traced by tracemalloc) and the time of
+     - produce_bsm_particle, and
+     - a deepcopy of the SM particle, i.e. the overhead previously paid on top of it.
+    The VEGAS unweighting is the same in both cases and would dominate both numbers, so one dark
+    sample per process is drawn beforehand and reused.
+
+    Typical usage:
+
+    python dark_allocation_benchmark.py -dict_dir=../data/ -target=lead -mV=0.03 -energy=10
+"""
+import time
+import argparse
+import tracemalloc
+import numpy as np
+from copy import deepcopy
+from PETITE.dark_shower import DarkShower
+from PETITE.particle import Particle
+
+def measure(function, arguments):
+    ''' Call function(*args) for each args in arguments, recording allocations and time of each call.
+    Input:
+        function: function to call
+        arguments: list of argument tuples
+    Output:
+        mean peak memory allocated per call in bytes, mean time per call in seconds
+    '''
+    peaks = np.zeros(len(arguments))
+    tracemalloc.start()
+    for ii, args in enumerate(arguments):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        result = function(*args)
+        peaks[ii] = tracemalloc.get_traced_memory()[1] - baseline
+        del result
+    tracemalloc.stop()
+    # the timing is taken without tracing in a second pass
+    start = time.perf_counter()
+    for args in arguments:
+        function(*args)
+    return(np.mean(peaks), (time.perf_counter() - start)/len(arguments))
+
+def main(params):
+    np.random.seed(params['seed'])
+    dark_shower = DarkShower(params['dict_dir'], params['target'], params['min_energy'], 1000, params['mV'])
+    E0 = params['energy']
+    sm_shower = dark_shower.generate_shower(Particle([E0, 0, 0, np.sqrt(E0**2 - 0.000511**2)], [0, 0, 0], {'PID':11}))
+
+    weights = dark_shower.shower_BSM_weights(sm_shower)
+    emissions = [(sm_shower[ii], process, weights[ii, jj]) for ii, jj in zip(*np.nonzero(weights > 0.0))
+                 for process in [dark_shower.active_processes[jj]] if process != "TwoBody_BSMDecay"]
+    fixed_samples = {}
+    for particle, process, weight in emissions:
+        if process not in fixed_samples:
+            fixed_samples[process] = dark_shower.draw_dark_sample(particle.get_pf()[0], process=process)
+    dark_shower.draw_dark_sample = lambda Einc, process="DarkBrem", VB=False: fixed_samples[process]
+
+    produce_bytes, produce_time = measure(dark_shower.produce_bsm_particle, emissions)
+    copy_bytes, copy_time = measure(deepcopy, [(particle,) for particle, process, weight in emissions])
+    print(str(len(sm_shower)) + ' SM particles, ' + str(len(emissions)) + ' dark emissions')
+    print('produce_bsm_particle: ' + str(round(produce_bytes)) + ' bytes, ' + str(round(produce_time*1e6, 1)) + ' us per emission')
+    print('deepcopy of the SM particle (no longer done): ' + str(round(copy_bytes)) + ' bytes, ' + str(round(copy_time*1e6, 1)) + ' us per emission')
+    return(produce_bytes, copy_bytes)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure allocations of dark vector production per SM particle', formatter_class = argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-dict_dir', type=str, default='../data/', help='directory containing the processed integrators')
+    parser.add_argument('-target', type=str, default='lead', help='target material')
+    parser.add_argument('-mV', type=float, default=0.03, help='dark vector mass in GeV')
+    parser.add_argument('-energy', type=float, default=10., help='energy of the incident electron in GeV')
+    parser.add_argument('-min_energy', type=float, default=0.01, help='minimum energy of shower particles in GeV')
+    parser.add_argument('-seed', type=int, default=0, help='seed of the shower')
+    args = parser.parse_args()
+    main({'dict_dir':args.dict_dir, 'target':args.target, 'mV':args.mV,
+          'energy':args.energy, 'min_energy':args.min_energy, 'seed':args.seed})
@@ -14,6 +14,7 @@ import os, sys
 
 from PETITE.all_processes import *
 import pickle
+from functools import partial
 import copy
 import numpy as np
 import argparse
@@ -42,6 +43,9 @@ process_info ={    'PairProd' : {'diff_xsection': dsigma_pairprod_dimensionless}
                     'DarkAnn':  {'diff_xsection': dsigma_radiative_return_du},
                     'DarkComp': {'diff_xsection':dsigma_compton_dCT}}
 
+# Vectorized version of each differential cross section, used to evaluate whole batches of points
+batch_diff_xsecs = {diff_xsection_options[process]:diff_xsection_batch_options[process] for process in diff_xsection_options}
+
 def get_file_names(path):
     ''' Get the names of all the files in a directory.
     Input:
@@ -59,12 +63,26 @@ def get_file_names(path):
         readme_file = 0
     return(pickle_files, readme_file)
 
+def diff_xsec_batch(diff_xsec, event_info, x):
+    """ Evaluate a differential cross section on a batch of points.
+    Input:
+        diff_xsec: differential cross section function (see process_info)
+        event_info: dictionary of event information passed to diff_xsec
+        x: array of shape (n_points, n_dim) of integration variables (as given by vegas random_batch())
+    Output:
+        array of shape (n_points,) of differential cross sections
+    """
+    if diff_xsec in batch_diff_xsecs:
+        return batch_diff_xsecs[diff_xsec](event_info, x)
+    return np.reshape(np.asarray(diff_xsec(event_info, x), dtype=float), len(x))
+
 # do the find max work on an individual file
-def do_find_max_work(params, process_file):
+def do_find_max_work(params, process_file, seed=None):
     """ Find the maximum value of the integrand for a given process_file.
     Input:
         params: dictionary of parameters for the process
         process_file: array of event_info and integrand which was read from a file (0.p, 1.p, ...)
+        seed: optional seed for the random numbers used by VEGAS (default: VEGAS's own generator)
     Output:
         samp_dict: dictionary of information about the sampling, containing:
             'neval': number of evaluations used in VEGAS (neval)
@@ -82,6 +100,13 @@ def do_find_max_work(params, process_file):
     integrand = vegas.Integrator(map=integrand_or_map, **vegas_integrator_options[event_info['process']])#nstrat=nstrat_options[params['process']])
     save_copy = copy.deepcopy(integrand_or_map)
 
+    # event_info for each target material, built once rather than for every sampled point
+    event_info_TM = {}
+    for tm in params['process_targets']:
+        event_info_TM[tm] = dict(event_info, Z_T=target_information[tm]['Z_T'], A_T=target_information[tm]['A_T'], mT=target_information[tm]['mT'])
+        if 'mV' in params:
+            event_info_TM[tm]['mV'] = params['mV']
+
     max_F_TM = {}
     xSec = {}
     for tm in params['process_targets']:
@@ -89,20 +114,14 @@ def do_find_max_work(params, process_file):
         max_F_TM[tm] = 0.0
 
     integrand.set(max_nhcube=1, neval=params['neval'])
+    if seed is not None:
+        integrand.set(ran_array_generator=np.random.default_rng(seed).random)
     for trial_number in range(params['n_trials']):
-        for x, wgt in integrand.random(): #scan over integrand
-
+        for x, wgt in integrand.random_batch(): #scan over integrand, one batch of points at a time
             for tm in params['process_targets']:
-                event_info_target = copy.deepcopy(event_info)
-                event_info_target['Z_T'] = target_information[tm]['Z_T']
-                event_info_target['A_T'] = target_information[tm]['A_T']
-                event_info_target['mT'] = target_information[tm]['mT']
-                if 'mV' in params:
-                    event_info_target['mV'] = params['mV']
-                MM = wgt*diff_xsec(event_info_target, x)
-                if MM > max_F_TM[tm]:
-                    max_F_TM[tm] = MM
-                xSec[tm] += MM/params['n_trials']
+                MM = wgt*diff_xsec_batch(diff_xsec, event_info_TM[tm], x)
+                max_F_TM[tm] = max(max_F_TM[tm], np.max(MM))
+                xSec[tm] += np.sum(MM)/params['n_trials']
 
     samp_dict_info = {"neval":params['neval'], "max_F": {tm:max_F_TM[tm] for tm in params['process_targets']}, "adaptive_map": save_copy}
     if "Eg_min" in event_info.keys():
@@ -113,6 +132,44 @@ def do_find_max_work(params, process_file):
     #xSec_dict = [event_info['E_inc'], xSec]
     return(samp_dict, xSec, event_info['E_inc'])
 
+def find_max_task(task):
+    """ Run do_find_max_work for a single (mV, process, energy node) task; used by run_find_max_tasks.
+    Input:
+        task: tuple (task_index, params, adaptive_map, seed) where adaptive_map is one entry of a <process>_AdaptiveMaps.npy file
+    Output:
+        task_index and the output of do_find_max_work
+    """
+    task_index, params, adaptive_map, seed = task
+    return(task_index, do_find_max_work(params, adaptive_map, seed=seed))
+
+def run_find_max_tasks(params, tasks):
+    """ Run do_find_max_work on a list of independent tasks, in parallel if requested.
+    Input:
+        params: dictionary of parameters containing (optionally)
+            'n_processes': number of worker processes (default: all available cores; 1 runs serially)
+            'seed': base seed from which the seed of every task is derived (default: 0)
+        tasks: list of (task_key, task_params, adaptive_map), where task_key is a tuple of integers identifying the task
+            (e.g. (mass index, process index, energy index)) from which its seed is derived
+    Output:
+        list of the outputs of do_find_max_work, in the same order as tasks
+    """
+    from multiprocessing import Pool
+    base_seed = params.get('seed', 0)
+    # the seed of each task depends only on the base seed and the task key, not on the worker that runs it
+    seeded_tasks = [(task_index, task_params, adaptive_map, int(np.random.SeedSequence([base_seed, *task_key]).generate_state(1)[0]))
+                    for task_index, (task_key, task_params, adaptive_map) in enumerate(tasks)]
+    results = [None]*len(tasks)
+    n_processes = params.get('n_processes', None)
+    if n_processes == 1:
+        for task in tqdm(seeded_tasks, desc='find_maxes'):
+            task_index, result = find_max_task(task)
+            results[task_index] = result
+    else:
+        with Pool(processes=n_processes) as pool:
+            for task_index, result in tqdm(pool.imap_unordered(find_max_task, seeded_tasks), total=len(seeded_tasks), desc='find_maxes'):
+                results[task_index] = result
+    return(results)
+
 def main(params):
     """ Find the maximum value of the integrand for a given process by looking into the directory containing the adaptive maps.
     Input:
@@ -153,8 +210,9 @@ def main(params):
         if process not in ['PairProd', 'Comp', 'Ann', 'Brem', 'Moller', 'Bhabha']:
             raise ValueError('Process \'', process ,'\' not in list of available processes for standard model showers.')
 
-    # Loop over all processes
-    for process in params['process']:
+    # Loop over all processes, collecting one task per adaptive map (energy node)
+    tasks = []
+    for process_index, process in enumerate(params['process']):
         # Get the path to the directory containing the adaptive maps
         path = params['save_location'] + '/auxiliary/' + process + '/'
         # Get adaptive map main file (created by stitch_integrators)
@@ -169,21 +227,23 @@ def main(params):
             final_xsec_dict[process][tm] = []
         print('File being processed: ', adaptive_maps_file)
         # Add relevant info to params
-        params['process']   = process
-        params['diff_xsec'] = process_info[process]['diff_xsection']
-        #params['FF_func']   = process_info[process]['form_factor']
-        #params['QSq_func']  = process_info[process]['QSq_func']
-
-        ####=====------ FIND MAX ------=====####
-        # loop over all adaptive_map in adaptive_maps
-        for adaptive_map in adaptive_maps:
-            sampling, cross_section, incoming_energy = do_find_max_work(params, adaptive_map)
-            # Append sampling dictionary to final sampling dictionary
-            final_sampling_dict[process].append(sampling)
-            # Append incoming energy and cross section dictionary to final cross section dictionary for each target material
-            for tm in params['process_targets']:
-                final_xsec_dict[process][tm].append([incoming_energy, cross_section[tm]])
-        ####=====------ FIND MAX ------=====####
+        process_params = dict(params, process=process, diff_xsec=process_info[process]['diff_xsection'])
+        #process_params['FF_func']   = process_info[process]['form_factor']
+        #process_params['QSq_func']  = process_info[process]['QSq_func']
+        for energy_index, adaptive_map in enumerate(adaptive_maps):
+            tasks.append(((process_index, energy_index), process_params, adaptive_map))
+
+    ####=====------ FIND MAX ------=====####
+    results = run_find_max_tasks(params, tasks)
+    # results are in the same order as tasks, i.e. by process and then by energy
+    for (task_key, process_params, adaptive_map), (sampling, cross_section, incoming_energy) in zip(tasks, results):
+        process = process_params['process']
+        # Append sampling dictionary to final sampling dictionary
+        final_sampling_dict[process].append(sampling)
+        # Append incoming energy and cross section dictionary to final cross section dictionary for each target material
+        for tm in params['process_targets']:
+            final_xsec_dict[process][tm].append([incoming_energy, cross_section[tm]])
+    ####=====------ FIND MAX ------=====####
 
     # Save sampling and cross section dictionaries to mother directory
     with open(params['save_location'] + '/sm_maps.pkl', 'wb') as f:
@@ -232,19 +292,20 @@ def main_dark(params):
     final_sampling_dict = {}
     final_xsec_dict = {}
     
-    #Loop over all masses
-    for mV in params['mV_list']:
+    # Before starting, check for invalid processes
+    for process in params['process']:
+        # if process is not in list of processes, raise an error
+        if process not in ['DarkBrem', 'DarkAnn', 'DarkComp']:
+            raise ValueError('Process \'', process ,'\' not in list of available processes for dark showers.')
+
+    #Loop over all masses and processes, collecting one task per adaptive map (energy node)
+    tasks = []
+    for mass_index, mV in enumerate(params['mV_list']):
         final_sampling_dict[mV] = {}
         final_xsec_dict[mV] = {}
 
-        # Before starting, check for invalid processes
-        for process in params['process']:
-            # if process is not in list of processes, raise an error
-            if process not in ['DarkBrem', 'DarkAnn', 'DarkComp']:
-                raise ValueError('Process \'', process ,'\' not in list of available processes for dark showers.')
-
         # Loop over all processes
-        for process in params['process']:
+        for process_index, process in enumerate(params['process']):
             # Get the path to the directory containing the adaptive maps
             path = params['save_location'] + '/auxiliary/' + process + '/mV_' + str(int(1000.*mV)) + "MeV/"
             adaptive_maps_file = path + process + '_AdaptiveMaps.npy'
@@ -258,23 +319,23 @@ def main_dark(params):
                 final_xsec_dict[mV][process][tm] = []
             print('File being processed: ', adaptive_maps_file)
             # Add relevant info to params
-            fm_params = copy.deepcopy(params)
-            fm_params['process']   = process
-            fm_params['mV']        = mV
-            fm_params['diff_xsec'] = process_info[process]['diff_xsection']
+            fm_params = dict(params, process=process, mV=mV, diff_xsec=process_info[process]['diff_xsection'])
             #fm_params['FF_func']   = process_info[process]['form_factor']
             #fm_params['QSq_func']  = process_info[process]['QSq_func']
-
-            ####=====------ FIND MAX ------=====####
-            # loop over all adaptive_map in adaptive_maps
-            for adaptive_map in adaptive_maps:
-                sampling, cross_section, incoming_energy = do_find_max_work(fm_params, adaptive_map)
-                # Append sampling dictionary to final sampling dictionary
-                final_sampling_dict[mV][process].append(sampling)
-                # Append incoming energy and cross section dictionary to final cross section dictionary for each target material
-                for tm in params['process_targets']:
-                    final_xsec_dict[mV][process][tm].append([incoming_energy, cross_section[tm]])
-            ####=====------ FIND MAX ------=====####
+            for energy_index, adaptive_map in enumerate(adaptive_maps):
+                tasks.append(((mass_index, process_index, energy_index), fm_params, adaptive_map))
+
+    ####=====------ FIND MAX ------=====####
+    results = run_find_max_tasks(params, tasks)
+    # results are in the same order as tasks, i.e. by mass, then process, then energy
+    for (task_key, fm_params, adaptive_map), (sampling, cross_section, incoming_energy) in zip(tasks, results):
+        mV, process = fm_params['mV'], fm_params['process']
+        # Append sampling dictionary to final sampling dictionary
+        final_sampling_dict[mV][process].append(sampling)
+        # Append incoming energy and cross section dictionary to final cross section dictionary for each target material
+        for tm in params['process_targets']:
+            final_xsec_dict[mV][process][tm].append([incoming_energy, cross_section[tm]])
+    ####=====------ FIND MAX ------=====####
 
     # Save sampling and cross section dictionaries to mother directory
     with open(params['save_location'] + '/dark_maps.pkl', 'wb') as f:
@@ -287,6 +348,99 @@ def main_dark(params):
 
 
 
+def missing_targets(maps, xsecs, new_targets, overwrite=False):
+    """ Targets of new_targets that are not yet in both a maps table and a cross section table (of one mass for dark showers)"""
+    if overwrite:
+        return(list(new_targets))
+    return([tm for tm in new_targets if any(tm not in sampling[1]['max_F'] for process in maps for sampling in maps[process])
+            or any(tm not in xsecs[process] for process in xsecs)])
+
+def target_task(params, process, targets, sampling, mV=None):
+    """ Parameters and process file for do_find_max_work to evaluate new targets with an adaptive map of an existing table
+    Input:
+        params: parameters as for main
+        process: string of process name
+        targets: target materials to evaluate
+        sampling: entry [energy, sampling dictionary] of sm_maps.pkl or dark_maps.pkl
+        mV: dark vector mass in GeV (dark processes only)
+    """
+    energy, sampling_dict = sampling
+    event_info = {'E_inc':energy, 'm_e':m_electron, 'alpha_FS':alpha_em, 'process':process, 'mV':0.0 if mV is None else mV}
+    for key in ['Eg_min', 'Ee_min']:
+        if key in sampling_dict:
+            event_info[key] = sampling_dict[key]
+    task_params = dict(params, process=process, process_targets=targets, neval=sampling_dict['neval'], diff_xsec=process_info[process]['diff_xsection'])
+    if mV is not None:
+        task_params['mV'] = mV
+    return(task_params, [event_info, sampling_dict['adaptive_map']])
+
+def add_targets(params):
+    """ Add target materials to existing maps and cross section tables without retraining any adaptive map.
+    The adaptive maps do not depend on the target, so max_F and the cross sections of the new targets are computed
+    by sampling the adaptive maps stored in the tables (as main and main_dark do), and merged into
+    sm_maps.pkl/sm_xsec.pkl and dark_maps.pkl/dark_xsec.pkl in place.
+    Tasks are keyed and seeded as in main and main_dark, so (for the same seed, n_trials and table order) the results
+    are the same as if the targets had been included in the original run.
+    Input:
+        params: dictionary of parameters containing the following keys:
+            'new_targets': list of target materials to add (keys of target_information)
+            'save_location': directory containing the tables
+            'n_trials': number of evaluations used to estimate the cross section (default: 100)
+            'overwrite': recompute targets that are already in the tables (default: False)
+            'n_processes', 'seed': as for main
+    """
+    from generate_integrators import write_atomically
+    params = dict(params)
+    if 'n_trials' not in params:
+        params['n_trials'] = 100
+    for tm in params['new_targets']:
+        if tm not in target_information:
+            raise ValueError('Target \'' + tm + '\' not in target_information (see physical_constants.py)')
+
+    for maps_name, xsec_name, dark in [('sm_maps.pkl', 'sm_xsec.pkl', False), ('dark_maps.pkl', 'dark_xsec.pkl', True)]:
+        maps_file, xsec_file = os.path.join(params['save_location'], maps_name), os.path.join(params['save_location'], xsec_name)
+        if not (os.path.exists(maps_file) and os.path.exists(xsec_file)):
+            print('No ' + maps_name + ' and ' + xsec_name + ' in ' + params['save_location'] + ', skipping')
+            continue
+        with open(maps_file, 'rb') as f:
+            all_maps = pickle.load(f)
+        with open(xsec_file, 'rb') as f:
+            all_xsecs = pickle.load(f)
+        # the SM tables are handled as dark tables with a single (dummy) mass
+        mass_tables = [(mV, all_maps[mV], all_xsecs[mV]) for mV in all_maps] if dark else [(None, all_maps, all_xsecs)]
+
+        tasks, targets = [], {}
+        for mass_index, (mV, maps, xsecs) in enumerate(mass_tables):
+            targets[mV] = missing_targets(maps, xsecs, params['new_targets'], params.get('overwrite', False))
+            if len(targets[mV]) == 0:
+                continue
+            for process_index, process in enumerate(maps):
+                for energy_index, sampling in enumerate(maps[process]):
+                    task_key = (mass_index, process_index, energy_index) if dark else (process_index, energy_index)
+                    tasks.append((task_key, *target_task(params, process, targets[mV], sampling, mV)))
+        if len(tasks) == 0:
+            print('All targets already in ' + maps_name + ' and ' + xsec_name)
+            continue
+        print('Adding targets to ' + maps_name + ' and ' + xsec_name + ': ' + str({mV:targets[mV] for mV in targets if len(targets[mV]) > 0}))
+
+        results = run_find_max_tasks(params, tasks)
+        for (task_key, task_params, process_file), (sampling, cross_section, incoming_energy) in zip(tasks, results):
+            mV = task_params['mV'] if dark else None
+            maps, xsecs = (all_maps[mV], all_xsecs[mV]) if dark else (all_maps, all_xsecs)
+            process, energy_index = task_params['process'], task_key[-1]
+            for tm in task_params['process_targets']:
+                maps[process][energy_index][1]['max_F'][tm] = sampling[1]['max_F'][tm]
+                if energy_index == 0:
+                    xsecs[process][tm] = []
+                xsecs[process][tm].append([incoming_energy, cross_section[tm]])
+
+        # maps first: an interrupted run leaves targets missing from the cross sections, so they are recomputed next time
+        write_atomically(maps_file, partial(pickle.dump, all_maps))
+        write_atomically(xsec_file, partial(pickle.dump, all_xsecs))
+        print('Updated ' + maps_file + ' and ' + xsec_file)
+    return
+
+
 startTime = datetime.now()
 
 
@@ -309,6 +463,8 @@ if __name__ == "__main__":
     parser.add_argument('-verbosity', type=bool, default=False, help='verbosity mode')
     parser.add_argument('-neval', type=int, default=300, help='neval value to provide to VEGAS for making integrator objects', required=True)
     parser.add_argument('-n_trials', type=int, default=100, help='number of evaluations to perform for estimating cross-section', required=True)
+    parser.add_argument('-n_processes', type=int, default=None, help='number of worker processes (default: all available cores, 1 runs serially)')
+    parser.add_argument('-seed', type=int, default=0, help='base seed for the VEGAS random numbers of each (mV, process, energy) task')
 
     args = parser.parse_args()
     print(args)
@@ -318,7 +474,7 @@ if __name__ == "__main__":
         processes_to_do = [args.process]
     params = {'A': args.A, 'Z_T': np.unique(args.Z), 'mT': args.mT, 'process':processes_to_do, 
               'import_directory': args.import_directory, 'save_location': args.save_location, 'verbosity_mode': args.verbosity,
-              'neval':args.neval, 'n_trials':args.n_trials}
+              'neval':args.neval, 'n_trials':args.n_trials, 'n_processes':args.n_processes, 'seed':args.seed}
     main(params)
 
     print("Run Time of Script:  ", datetime.now() - startTime)
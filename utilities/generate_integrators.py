@@ -15,6 +15,8 @@ from glob import glob
 from copy import deepcopy
 from multiprocessing import Pool
 import pickle
+import shutil
+import tempfile
 from functools import partial
 import argparse
 import datetime
@@ -24,6 +26,25 @@ import vegas
 def generate_vector_mass_string(mV):
     return str(int(np.floor(mV*1000.)))+"MeV"
 
+def write_atomically(file_name, write_function):
+    """Writes a file so that it either exists complete or not at all: the content is written to a temporary 
+    file in the same directory, which is then renamed to file_name. An interrupted run therefore never
+    leaves a truncated file behind that would later be mistaken for a finished result.
+    Input:
+        file_name: path of the file to write
+        write_function: function taking an open binary file object and writing the content to it
+    """
+    directory = os.path.dirname(os.path.abspath(file_name))
+    file_descriptor, temporary_name = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(file_name) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'wb') as f:
+            write_function(f)
+        os.replace(temporary_name, file_name)
+    except BaseException:
+        if os.path.exists(temporary_name):
+            os.remove(temporary_name)
+        raise
+
 def make_readme(params, process, process_directory):
     """Creates a readme file to accompany the integrators with supplementary information on the parameters used to generate the integrators (Z, A, mV, etc.)
     Input: 
@@ -37,6 +58,8 @@ def make_readme(params, process, process_directory):
         line = "\nTarget has (Z, A, mass) = ({atomic_Z}, {atomic_A}, {atomic_mass})\n".\
             format(atomic_Z=params['Z_T'], atomic_A=params['A_T'], atomic_mass=params['mT'])
         readme_file.write(line)
+    if params.get('warm_start', False):
+        readme_file.write("\nIntegrators warm-started from the previous energy in " + str(params.get('n_chains', os.cpu_count())) + " chains\n")
     readme_file.write("\n\nEnergy/GeV |  Filename\n\n")
     for index, energy in enumerate(params['initial_energy_list']):
         line = "{en:9.3f}  |  {proc}_{indx}.p\n".format(en = energy, indx = index, proc=process)
@@ -46,7 +69,7 @@ def make_readme(params, process, process_directory):
     return()
 
 
-def run_vegas_in_parallel(params, process, verbosity_mode, process_directory, energy_index):
+def run_vegas_in_parallel(params, process, verbosity_mode, process_directory, energy_index, adaptive_map=None):
     '''Run VEGAS in parallel for a given energy index and process, and save the integrator adaptive map 
     and relevant parameters to a pickle file.
     Input:
@@ -59,35 +82,65 @@ def run_vegas_in_parallel(params, process, verbosity_mode, process_directory, en
         verbosity_mode: boolean
         process_directory: directory where files should be saved
         energy_index: index of energy in initial_energy_list
+        adaptive_map: trained adaptive map at a neighbouring energy to warm-start from (None for a full burn-in)
+    Output:
+        adaptive map of the integrator for this energy (loaded from file if it was already generated)
     '''
     params['E_inc'] = params['initial_energy_list'][energy_index]
     file_name = process_directory + process + '_' + str(energy_index) + ".p"
     if os.path.exists(file_name):
         print("Already generated integrator for this point\n")
+        with open(file_name, 'rb') as f:
+            return(pickle.load(f)[1])
     else:
         print('Starting VEGAS for energy index ',energy_index)
-        VEGAS_integrator = vegas_integration(params, process, verbose=verbosity_mode, mode='Pickle') 
+        VEGAS_integrator = vegas_integration(params, process, verbose=verbosity_mode, mode='Pickle', adaptive_map=adaptive_map, batch=params.get('batch_integrands', True)) 
         #VEGAS_integrator = 0
         print('Done VEGAS for energy index ',energy_index)
         # Objects to be saved. Should include all important parameters (in params) and the VEGAS integrator adaptive map.
         params['process'] = process
         object_to_save = [params, VEGAS_integrator.map]
-        pickle.dump(object_to_save, open(file_name, "wb"))
+        write_atomically(file_name, partial(pickle.dump, object_to_save))
         print('File created: ' + file_name)
+    return(VEGAS_integrator.map)
+
+def run_vegas_chain(params, process, verbosity_mode, process_directory, energy_indices):
+    '''Train the integrators of consecutive energies one after the other, starting each one from the
+    adaptive map of the previous energy (the first one gets a full burn-in).
+    Input:
+        as for run_vegas_in_parallel, with energy_indices a list of consecutive indices in initial_energy_list
+    '''
+    adaptive_map = None
+    for energy_index in energy_indices:
+        adaptive_map = run_vegas_in_parallel(params, process, verbosity_mode, process_directory, energy_index, adaptive_map=adaptive_map)
     return()
 
+def training_chains(params):
+    '''Split the energy indices of params['initial_energy_list'] into the chains trained by run_vegas_chain.
+    With params['warm_start'] (default False) the energy grid is cut into params['n_chains'] (default: number of cores)
+    contiguous chains that are trained sequentially in energy; otherwise every energy is trained independently.
+    Output:
+        list of lists of energy indices
+    '''
+    n_energies = len(params['initial_energy_list'])
+    if not params.get('warm_start', False):
+        return([[energy_index] for energy_index in range(n_energies)])
+    n_chains = min(params.get('n_chains', os.cpu_count()), n_energies)
+    return([list(chain) for chain in np.array_split(np.arange(n_energies), n_chains)])
 
 
-def make_integrators(params, process):
+
+def prepare_training_params(params, process):
     """
-    Generate vegas integrator pickles for a given process and set of parameters.
+    Add target and constant information to the training parameters of a process and find where its integrators are saved.
     Input:
         params: dictionary of parameters containing
             mV : dark vector mass in GeV
-            A : target atomic mass number
-            Z : target atomic number
-            mT : target mass in GeV
+            training_target : target on which to train (dark processes only)
+            save_location : mother directory for the integrators
         process: string of process name
+    Output:
+        process_directory: directory where the integrators of this process (and mass) are saved
     """
     if 'mV' not in params:
         mV = 0.0
@@ -116,16 +169,26 @@ def make_integrators(params, process):
             params['mT'] = target_information['hydrogen']['mT']
         # Create process specific directory in mother directory for saving VEGAS adaptive maps
         process_directory = params['save_location'] + '/' + process + '/'
-
-
-    verbosity_mode = params['verbosity']
     params['m_e'] = m_electron
     params['alpha_FS'] = alpha_em
+    return(process_directory)
 
-    initial_energy_list = params['initial_energy_list']
-    
-    vec_mass_string = generate_vector_mass_string(mV)
-    energy_index_list = range(len(initial_energy_list))
+def make_integrators(params, process):
+    """
+    Generate vegas integrator pickles for a given process and set of parameters.
+    Input:
+        params: dictionary of parameters containing
+            mV : dark vector mass in GeV
+            A : target atomic mass number
+            Z : target atomic number
+            mT : target mass in GeV
+            warm_start : train sequentially in energy, warm-starting from the previous energy (optional, see training_chains)
+            n_chains : number of independent warm-started chains (optional)
+            batch_integrands : evaluate the cross sections on batches of points (optional, default True; False uses the point-by-point versions)
+        process: string of process name
+    """
+    process_directory = prepare_training_params(params, process)
+    verbosity_mode = params['verbosity']
 
     print("Parameters:")
     print(params)
@@ -135,11 +198,10 @@ def make_integrators(params, process):
     # vec_mass_string = generate_vector_mass_string(params['mV'])
     
     # If directory does not exist, create it
-    if not(os.path.exists(process_directory)):
-        os.system("mkdir -p " + process_directory)
+    os.makedirs(process_directory, exist_ok=True)
     # pool parallelizes the generation of integrators    
-    pool = Pool()
-    res = pool.map(partial(run_vegas_in_parallel, params, process, verbosity_mode, process_directory), energy_index_list)
+    with Pool() as pool:
+        res = pool.map(partial(run_vegas_chain, params, process, verbosity_mode, process_directory), training_chains(params))
     # make the human readable file contining info on params of run and put in directory 
     make_readme(params, process, process_directory)
     print('make_integrators is complete, readme files created in ' + process_directory + ' for convenience')
@@ -198,7 +260,7 @@ def stitch_integrators(dir):
     to_save = [pickle.load(open(file_name, 'rb')) for file_name in files]  
     # save stitched integrator as numpy arrays
     file_name = dir + '/' + process + '_AdaptiveMaps.npy'
-    np.save(file_name, to_save)
+    write_atomically(file_name, lambda f: np.save(f, np.array(to_save, dtype=object), allow_pickle=True))
     print('Stitched integrator saved as ' + file_name)
     return
 
@@ -210,7 +272,8 @@ def cleanup(dir):
         dir: directory where cleanup to be done
     """
     print("Cleaning up files in " + dir)
-    os.system("rm " + dir + "*.p")
+    for file_name in glob(dir + "*.p"):
+        os.remove(file_name)
     return
 
 def organize_directories_final(dir):
@@ -220,11 +283,101 @@ def organize_directories_final(dir):
     # get all directories in mother directory
     directories = glob(dir + '/*/')
     # create auxiliary directory if it doesn't exist
-    if not(os.path.exists(dir + '/auxiliary/')):
-        os.system("mkdir -p " + dir + "/auxiliary/")
+    os.makedirs(dir + '/auxiliary/', exist_ok=True)
     # move all directories to auxiliary directory
     for directory in directories:
-        os.system("mv " + directory + " " + dir + "/auxiliary/")
+        if os.path.basename(os.path.normpath(directory)) != 'auxiliary':
+            shutil.move(directory, dir + '/auxiliary/')
+    return
+
+# Relative cost of one (batch) integrand evaluation, only used to order training tasks
+# (the exact tree-level DarkBrem cross section is somewhat more expensive than the others)
+integrand_evaluation_cost = {'DarkBrem': 1.3}
+
+def estimated_training_cost(process):
+    """Rough relative cost of training one VEGAS integrator for `process', used for load balancing"""
+    options = vegas_integrator_options[process]
+    if 'neval' in options:
+        n_evaluations = options['neval']
+    else:
+        n_evaluations = 2*np.prod(options['nstrat'])
+    return options['nitn']*n_evaluations*integrand_evaluation_cost.get(process, 1.0)
+
+def run_training_task(task):
+    """Train the integrators of a single (process, mV, chain of energies) task; used by run_training_pipeline.
+    Input:
+        task: tuple (params, process, process_directory, energy_indices)
+    """
+    params, process, process_directory, energy_indices = task
+    run_vegas_chain(params, process, params['verbosity'], process_directory, energy_indices)
+    return(process, process_directory, energy_indices)
+
+def move_to_auxiliary(save_location, process_directory, process):
+    """Moves the readme and stitched adaptive maps of a process (and mass) from process_directory to 
+    the corresponding directory in save_location/auxiliary/, where find_maxes looks for them.
+    The adaptive maps are moved last, so that their presence marks a finished process.
+    """
+    target_directory = os.path.join(save_location, 'auxiliary', os.path.relpath(process_directory, save_location))
+    os.makedirs(target_directory, exist_ok=True)
+    for file_name in [process + "_readme.txt", process + "_AdaptiveMaps.npy"]:
+        os.replace(os.path.join(process_directory, file_name), os.path.join(target_directory, file_name))
+    return(os.path.join(target_directory, process + "_AdaptiveMaps.npy"))
+
+def run_training_pipeline(task_specs, processing_params=None, n_processes=None):
+    """
+    Train, stitch and process all integrators in a single restartable run.
+    All (process, mV, energy) training tasks are enumerated up front and run on one worker pool, heaviest
+    tasks first so that they do not end up queued behind each other at the end of the run. Each integrator
+    is written atomically as soon as it is done, so an interrupted run resumes from the finished tasks;
+    processes (and masses) whose final adaptive maps are already in save_location/auxiliary/ are skipped
+    (after removing any per-energy integrators an interrupted run left behind).
+    Once all training is done, the integrators are stitched, moved to save_location/auxiliary/ and find_maxes is run.
+    Input:
+        task_specs: list of (params, process) pairs, with params as for make_integrators (including 'initial_energy_list',
+            'save_location', 'verbosity', optionally 'warm_start' and 'n_chains' (see training_chains) and, for dark processes, 'mV' and 'training_target')
+        processing_params: parameters passed to call_find_maxes (including 'process_targets' and 'save_location');
+            find_maxes is not run if None
+        n_processes: number of worker processes (default: all available cores)
+    """
+    groups, tasks = [], []
+    for params, process in task_specs:
+        params = deepcopy(params)
+        process_directory = prepare_training_params(params, process)
+        final_file = os.path.join(params['save_location'], 'auxiliary', os.path.relpath(process_directory, params['save_location']), process + "_AdaptiveMaps.npy")
+        if os.path.exists(final_file):
+            print("Already finished " + final_file + ", skipping")
+            #a run interrupted between move_to_auxiliary and cleanup leaves the per-energy integrators behind
+            if os.path.isdir(process_directory):
+                cleanup(process_directory)
+            continue
+        os.makedirs(process_directory, exist_ok=True)
+        groups.append((params, process, process_directory))
+        for energy_indices in training_chains(params):
+            n_missing = sum([not os.path.exists(process_directory + process + '_' + str(energy_index) + ".p") for energy_index in energy_indices])
+            if n_missing > 0:
+                tasks.append((n_missing*estimated_training_cost(process), (params, process, process_directory, energy_indices)))
+    tasks = [task for cost, task in sorted(tasks, key=lambda cost_and_task: -cost_and_task[0])]
+    print(str(len(tasks)) + " training tasks for " + str(len(groups)) + " processes/masses")
+
+    if len(tasks) > 0:
+        with Pool(processes=n_processes) as pool:
+            for n_done, (process, process_directory, energy_indices) in enumerate(pool.imap_unordered(run_training_task, tasks, chunksize=1)):
+                print("Finished " + process + " integrators " + str(energy_indices[0]) + "-" + str(energy_indices[-1]) + " in " + process_directory + " (" + str(n_done + 1) + "/" + str(len(tasks)) + ")")
+
+    for params, process, process_directory in groups:
+        make_readme(params, process, process_directory)
+        stitch_integrators(process_directory)
+        move_to_auxiliary(params['save_location'], process_directory, process)
+        cleanup(process_directory)
+
+    if processing_params is not None:
+        sm_processes = [process for params, process in task_specs if process not in ['DarkBrem', 'DarkAnn', 'DarkComp']]
+        dark_processes = [process for params, process in task_specs if process in ['DarkBrem', 'DarkAnn', 'DarkComp']]
+        if len(sm_processes) > 0:
+            call_find_maxes(dict(processing_params), list(dict.fromkeys(sm_processes)))
+        if len(dark_processes) > 0:
+            mV_list = sorted(set([params['mV'] for params, process in task_specs if process in dark_processes]))
+            call_find_maxes(dict(processing_params, mV_list=mV_list), list(dict.fromkeys(dark_processes)))
     return
 
 
@@ -238,7 +391,9 @@ def main(args):
     """
 
     #params = {'A_T': args.A, 'Z_T': np.unique(args.Z), 'mT': args.mT, 'save_location': args.save_location, 'run_find_maxes':args.run_find_maxes}
-    training_params = {'save_location':args.save_location, 'verbosity':args.verbosity}
+    training_params = {'save_location':args.save_location, 'verbosity':args.verbosity, 'warm_start':args.warm_start, 'batch_integrands':not args.scalar_integrands}
+    if args.n_chains is not None:
+        training_params['n_chains'] = args.n_chains
     if args.training_target != "unspecified":
         training_params['training_target'] = args.training_target
     processing_params = {'process_targets':args.process_targets, 'save_location':args.save_location, 'verbosity':args.verbosity, 'mV_list':args.mV}
@@ -308,6 +463,9 @@ if __name__ == '__main__':
     parser.add_argument('-num_energy_pts', type=int, default=100, help='number of initial energy values to evaluate, scan is done in log space')
     parser.add_argument('-run_find_maxes', type=bool, default=True,  help='run Find_Maxes.py after done')
     parser.add_argument('-verbosity', type=bool, default=False, help='verbosity mode')
+    parser.add_argument('-warm_start', action='store_true', help='train sequentially in energy, starting each integrator from the adaptive map of the previous energy')
+    parser.add_argument('-scalar_integrands', action='store_true', help='evaluate the cross sections point by point instead of on batches of points (slow, for cross-checks)')
+    parser.add_argument('-n_chains', type=int, default=None, help='number of independent warm-started chains per process (default: number of cores)')
     # stich integrators
     parser.add_argument('-stitch', type=bool, default=True, help='stitch integrators for different energies together')
 
@@ -0,0 +1,61 @@
+""" Measure the import time of PETITE modules with `python -X importtime` and check it against a budget.
+
+    Heavy dependencies (vegas, scipy, matplotlib) are only imported on first use, so importing
+    the shower machinery (e.g. in pool workers or short command-line jobs) should stay cheap.
+    The script exits with status 1 if the cumulative import time of the module exceeds the budget,
+    or if one of the deferred dependencies is imported eagerly.
+
+    Typical usage:
+
+    python import_time_benchmark.py -module=PETITE.shower -budget=0.3
+"""
+import sys
+import argparse
+import subprocess
+
+# Dependencies that must not be imported when the module is imported
+deferred_modules = ['vegas', 'scipy', 'matplotlib']
+
+def measure_import_time(module, python=sys.executable):
+    ''' Import `module` in a fresh interpreter with -X importtime.
+    Input:
+        module: name of the module to import, e.g. 'PETITE.shower'
+        python: python executable to use
+    Output:
+        total_time: cumulative import time of `module` in seconds
+        timings: dictionary {imported module: cumulative import time in seconds}
+    '''
+    result = subprocess.run([python, '-X', 'importtime', '-c', 'import ' + module], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError('Importing ' + module + ' failed:\n' + result.stderr)
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_time, cumulative_time, name = line[len('import time:'):].split('|')
+        timings[name.strip()] = int(cumulative_time)*1e-6
+    return timings[module], timings
+
+def main(module, budget, n_slowest=10):
+    total_time, timings = measure_import_time(module)
+    print('import ' + module + ': ' + str(round(total_time, 4)) + ' s (budget ' + str(budget) + ' s)')
+    print('Slowest imports (cumulative):')
+    for name, t in sorted(timings.items(), key=lambda item: -item[1])[:n_slowest]:
+        print('    ' + name + ': ' + str(round(t, 4)) + ' s')
+    eager_imports = [name for name in deferred_modules if any(imported == name or imported.startswith(name + '.') for imported in timings)]
+    if len(eager_imports) > 0:
+        print('FAIL: deferred dependencies imported eagerly: ' + ', '.join(eager_imports))
+        return 1
+    if total_time > budget:
+        print('FAIL: import time over budget')
+        return 1
+    print('OK')
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check the import time of a PETITE module', formatter_class = argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-module', type=str, default='PETITE.shower', help='module to import')
+    parser.add_argument('-budget', type=float, default=0.3, help='maximum allowed cumulative import time in seconds')
+    parser.add_argument('-n_slowest', type=int, default=10, help='number of slowest imports to print')
+    args = parser.parse_args()
+    sys.exit(main(args.module, args.budget, args.n_slowest))
@@ -7,7 +7,10 @@ path = os.getcwd()
 path = os.path.split(path)[0]
 print(path)
 
-def main(doSM=True, doDark=True):
+def main(doSM=True, doDark=True, n_processes=None):
+    # All (process, mass, energy) integrators are trained on a single worker pool by run_training_pipeline;
+    # finished integrators are kept, so rerunning this script after an interruption resumes where it stopped
+    task_specs = []
     ##################################
     ##         SM processes         ##
     ##################################
@@ -15,26 +18,12 @@ def main(doSM=True, doDark=True):
     initial_energy_list = np.logspace(np.log10(0.0016), np.log10(100), 100)
     # Necessary parameters for generating the integrators, note save_location should be altered as preferred
     training_params = {'verbosity':True, 'initial_energy_list':initial_energy_list,
-                    'save_location':path + '/data',
-                    'run_find_maxes':True}
-    # Necessary parameters for processing the integrators to determine cross sections
-    processing_params = {'process_targets':['graphite','lead','iron','aluminum','beryllium'], 'save_location':path + '/data'}
-    #args = training_params.update(processing_params)
+                    'save_location':path + '/data/'}
     # List of processes to do
     processes_to_do = ['Comp', 'Ann', 'Moller', 'Bhabha', 'Brem', 'PairProd']
-    # Loop over processes, carrying out each step of the calculation, they can also be called in one command generate_integrators
     if doSM:
         for process in processes_to_do:
-            if os.path.exists(training_params['save_location'] + '/auxiliary/' + process + "/" + process + "_AdaptiveMaps.npy"):
-                print("Already finished this whole process, skipping")
-                continue
-            else:
-                generate_integrators.make_integrators(training_params, process)
-                generate_integrators.stitch_integrators(training_params['save_location'] + '/' + process + '/')
-                generate_integrators.cleanup(training_params['save_location'] + "/" + process + "/")
-        # List of processes to run find_maxes on, need not be the same as list above
-        find_maxes_processes_to_do = ['Brem', 'PairProd', 'Comp', 'Ann', 'Moller', 'Bhabha']
-        generate_integrators.call_find_maxes(processing_params, find_maxes_processes_to_do)
+            task_specs.append((training_params, process))
 
     ##################################
     ##         Dark processes       ##
@@ -44,9 +33,6 @@ def main(doSM=True, doDark=True):
     mV_list = [0.003, 0.010, 0.030, 0.100, 0.300, 1.000]
     #mV_list = np.logspace(np.log10(0.003), np.log10(0.200), 24)
     save_location = path + '/data/'
-    training_params = {'verbosity':True, 'initial_energy_list':initial_energy_list_general,
-                    'save_location':save_location,
-                    'run_find_maxes':True, 'mV_list':mV_list, 'training_target':'hydrogen', 'mT':200.0}
     processes_to_do = ['DarkAnn', 'DarkComp', 'DarkBrem']
 
     if doDark:
@@ -64,21 +50,14 @@ def main(doSM=True, doDark=True):
                     Eg0 = (mV*(1 + mV/(2*m_electron)))
                     Emax = np.max([100.0, 100*Eg0])
                     energy_list = Eg0*(1 + np.logspace(-4, np.log10((Emax - Eg0)/Eg0), len(energy_list)))
-                training_params.update({'initial_energy_list':energy_list})
-                training_params.update({"mV":mV})
-                if os.path.exists(training_params['save_location'] + '/auxiliary/' + process + '/mV_' + str(int(np.floor(mV*1000.))) + "MeV/" + process + "_AdaptiveMaps.npy"):
-                    print("Already finished this whole process, skipping")
-                    continue
-                else:
-                    generate_integrators.make_integrators(training_params, process)
-                    generate_integrators.stitch_integrators(training_params['save_location'] + process + '/mV_' + str(int(np.floor(mV*1000.))) + "MeV/")
-                    generate_integrators.cleanup(training_params['save_location'] + process + '/mV_' + str(int(np.floor(mV*1000.))) + "MeV/")
-                    generate_integrators.organize_directories_final(training_params['save_location'] + process + '/mV_' + str(int(np.floor(mV*1000.))) + "MeV/")
-                    #generate_integrators.stitch_integrators(training_params['save_location'] + process + '/mV_' + str(int(np.floor(mV*1000000.))) + "keV/")
-                    #generate_integrators.cleanup(training_params['save_location'] + process + '/mV_' + str(int(np.floor(mV*1000000.))) + "keV/")
+                training_params = {'verbosity':True, 'initial_energy_list':energy_list,
+                                'save_location':save_location,
+                                'mV':mV, 'training_target':'hydrogen', 'mT':200.0}
+                task_specs.append((training_params, process))
 
-        processing_params = {'process_targets':['graphite','lead','iron','aluminum','beryllium'], 'save_location':save_location, 'mV_list':mV_list}
-        generate_integrators.call_find_maxes(processing_params, processes_to_do)
+    # Necessary parameters for processing the integrators to determine cross sections
+    processing_params = {'process_targets':['graphite','lead','iron','aluminum','beryllium'], 'save_location':save_location}
+    generate_integrators.run_training_pipeline(task_specs, processing_params=processing_params, n_processes=n_processes)
 
 if __name__ == "__main__":
     main(doSM=True, doDark=True)